@@ -48,6 +48,8 @@ from .builder.builder_base import ModelParameters
 from .builder.builder_elph import BuilderElPh
 from .builder.builder_elph import BuilderManyBodyElPh
 from .builder.funcprop import FunctionProperties
+from .builder.sweep import SweepResults
+from .builder.sweep import parallel_sweep
 from .indexing import StateIndexing
 from .indexing import StateIndexingPauli
 from .indexing import StateIndexingDM
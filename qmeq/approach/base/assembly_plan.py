@@ -0,0 +1,278 @@
+"""Module containing python class, which stores precompiled kernel assembly plans."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import numpy as np
+from scipy import sparse
+
+from ...mytypes import complexnp
+from ...mytypes import doublenp
+from ...mytypes import longnp
+
+
+class AssemblyPlan(object):
+    """
+    Class for storing the index tables needed to assemble a master equation kernel.
+
+    The kernel entries are expressed through complex factors, each of which is a sum of terms
+    coeff*op[0][ind[0]]*op[1][ind[1]]*..., where op are flattened operand arrays like Tba
+    and phi1fct, which are optionally complex conjugated. A kernel entry is a real or imaginary
+    part of a factor multiplied by a sign. The index tables depend only on the state indexing,
+    so the plan is made once and the kernel at each new parameter point is obtained by
+    two bincount scatters.
+
+    Attributes
+    ----------
+    length : int
+        Number of rows and columns of the kernel.
+    nops : int
+        Number of operands in each term.
+    nfct : int
+        Number of factors.
+    term_fct : array
+        Factor, to which the term contributes.
+    term_ind : array
+        nops by nterms array of indices into the flattened operands.
+    term_conj : array
+        nops by nterms boolean array indicating if the operand is complex conjugated.
+    term_coeff : array
+        Coefficients of the terms.
+    rows, cols : array
+        Row and column indices of the kernel entries.
+    entry_fct : array
+        Factor, which determines the kernel entry.
+    entry_re, entry_im : array
+        Kernel entry is entry_re*fct.real + entry_im*fct.imag.
+    energy_rows, energy_cols, energy_b, energy_bp : array
+        Kernel entries given by energy differences E[b]-E[bp].
+    """
+
+    def __init__(self, length, nops):
+        self.length = length
+        self.nops = nops
+        self.nfct = 0
+        self.term_fct, self.term_ind, self.term_conj, self.term_coeff = [], [], [], []
+        self.rows, self.cols, self.entry_fct, self.entry_re, self.entry_im = [], [], [], [], []
+        self.energy_rows, self.energy_cols, self.energy_b, self.energy_bp = [], [], [], []
+
+    def new_fct(self):
+        """Returns the label of a new factor."""
+        self.nfct += 1
+        return self.nfct-1
+
+    def add_term(self, fct, ind, conj=None, coeff=1):
+        """
+        Adds the term coeff*op[0][ind[0]]*op[1][ind[1]]*... to the factor fct.
+
+        Parameters
+        ----------
+        fct : int
+            Label of the factor.
+        ind : list
+            Indices into the flattened operands.
+        conj : list
+            Flags indicating which operands are complex conjugated.
+        coeff : float or complex
+            Coefficient of the term.
+        """
+        self.term_fct.append(fct)
+        self.term_ind.append(ind)
+        self.term_conj.append([False]*self.nops if conj is None else conj)
+        self.term_coeff.append(coeff)
+
+    def add_entry(self, i, j, fct, re=0, im=0):
+        """Adds re*fct.real + im*fct.imag to the (i, j) entry of the kernel."""
+        self.rows.append(i)
+        self.cols.append(j)
+        self.entry_fct.append(fct)
+        self.entry_re.append(re)
+        self.entry_im.append(im)
+
+    def add_energy(self, i, j, b, bp):
+        """Adds E[b]-E[bp] to the (i, j) entry of the kernel."""
+        self.energy_rows.append(i)
+        self.energy_cols.append(j)
+        self.energy_b.append(b)
+        self.energy_bp.append(bp)
+
+    def finalize(self):
+        """Converts the recorded lists into arrays."""
+        nterms = len(self.term_fct)
+        self.term_fct = np.array(self.term_fct, dtype=longnp)
+        self.term_ind = np.array(self.term_ind, dtype=longnp).reshape(nterms, self.nops).T
+        self.term_conj = np.array(self.term_conj, dtype=bool).reshape(nterms, self.nops).T
+        self.term_coeff = np.array(self.term_coeff, dtype=complexnp)
+        self.rows = np.array(self.rows, dtype=longnp)
+        self.cols = np.array(self.cols, dtype=longnp)
+        self.entry_fct = np.array(self.entry_fct, dtype=longnp)
+        self.entry_re = np.array(self.entry_re, dtype=doublenp)
+        self.entry_im = np.array(self.entry_im, dtype=doublenp)
+        self.energy_rows = np.array(self.energy_rows, dtype=longnp)
+        self.energy_cols = np.array(self.energy_cols, dtype=longnp)
+        self.energy_b = np.array(self.energy_b, dtype=longnp)
+        self.energy_bp = np.array(self.energy_bp, dtype=longnp)
+        return self
+
+    def get_factors(self, ops):
+        """
+        Evaluates the factors for given operands.
+
+        Parameters
+        ----------
+        ops : list of arrays
+            Operand arrays, which are flattened.
+
+        Returns
+        -------
+        fct_re, fct_im : arrays
+            Real and imaginary parts of the factors.
+        """
+        vals = self.term_coeff
+        for op, ind, conj in zip(ops, self.term_ind, self.term_conj):
+            x = np.ravel(op)[ind]
+            if np.iscomplexobj(x):
+                x = np.where(conj, x.conjugate(), x)
+            vals = vals*x
+        fct_re = np.bincount(self.term_fct, weights=vals.real, minlength=self.nfct)
+        fct_im = np.bincount(self.term_fct, weights=vals.imag, minlength=self.nfct)
+        return fct_re, fct_im
+
+    def get_term_values(self, ops):
+        """
+        Evaluates the terms for the leading operands ops, which can be fewer than nops.
+
+        Parameters
+        ----------
+        ops : list of arrays
+            Operand arrays, which are flattened.
+
+        Returns
+        -------
+        ndarray
+            Values of the terms, which are products of the coefficients and the leading operands.
+        """
+        vals = self.term_coeff
+        for op, ind, conj in zip(ops, self.term_ind, self.term_conj):
+            x = np.ravel(op)[ind]
+            if np.iscomplexobj(x):
+                x = np.where(conj, x.conjugate(), x)
+            vals = vals*x
+        return vals
+
+    def get_factor_map(self, ops, length):
+        """
+        Evaluates the terms for all operands except the last one and collects them in a sparse
+        matrix, which maps the flattened last operand to the factors. The last operand is not
+        complex conjugated.
+
+        Parameters
+        ----------
+        ops : list of arrays
+            Operand arrays without the last operand.
+        length : int
+            Length of the flattened last operand.
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+            nfct by length matrix. The factors for a last operand x are given by fct_map.dot(x).
+        """
+        vals = self.get_term_values(ops[0:self.nops-1])
+        return sparse.csr_matrix((vals, (self.term_fct, self.term_ind[-1])), shape=(self.nfct, length))
+
+    def assemble_batch(self, ops, batch, E=None):
+        """
+        Assembles a stack of dense kernels for a batch of operands.
+
+        Parameters
+        ----------
+        ops : list of arrays
+            Operand arrays.
+        batch : list of bools
+            Flags indicating which operands have an additional first axis
+            enumerating the points of the batch.
+        E : array
+            Energies of the many-body states, which are the same for all points.
+
+        Returns
+        -------
+        ndarray
+            npoints by length by length array containing the kernels.
+        """
+        npoints = [len(op) for op, bq in zip(ops, batch) if bq][0]
+        vals = np.tile(self.term_coeff, (npoints, 1))
+        for op, bq, ind, conj in zip(ops, batch, self.term_ind, self.term_conj):
+            x = np.reshape(op, (npoints, -1))[:, ind] if bq else np.ravel(op)[ind]
+            if np.iscomplexobj(x):
+                x = np.where(conj, x.conjugate(), x)
+            vals = vals*x
+        # Sum the terms into factors and scatter the factors into kernels by sparse products
+        nterms = len(self.term_fct)
+        fct_map = sparse.csr_matrix((np.ones(nterms), (self.term_fct, np.arange(nterms))),
+                                    shape=(self.nfct, nterms))
+        fct = fct_map.dot(vals.T).T
+        nentries = len(self.rows)
+        entry_map = sparse.csr_matrix((np.ones(nentries), (self.rows*self.length+self.cols, np.arange(nentries))),
+                                      shape=(self.length*self.length, nentries))
+        entry_vals = self.entry_re*fct.real[:, self.entry_fct] + self.entry_im*fct.imag[:, self.entry_fct]
+        kern = entry_map.dot(entry_vals.T).T.reshape(npoints, self.length, self.length)
+        if E is not None and len(self.energy_rows) > 0:
+            np.add.at(kern, (slice(None), self.energy_rows, self.energy_cols), E[self.energy_b]-E[self.energy_bp])
+        return kern
+
+    def assemble(self, kh, ops, E=None):
+        """
+        Adds the kernel entries for given operands to the KernelHandler.
+
+        Parameters
+        ----------
+        kh : KernelHandler
+            KernelHandler object collecting the kernel.
+        ops : list of arrays
+            Operand arrays.
+        E : array
+            Energies of the many-body states.
+        """
+        fct_re, fct_im = self.get_factors(ops)
+        vals = self.entry_re*fct_re[self.entry_fct] + self.entry_im*fct_im[self.entry_fct]
+        kh.add_array(self.rows, self.cols, vals)
+        if E is not None and len(self.energy_rows) > 0:
+            kh.add_array(self.energy_rows, self.energy_cols, E[self.energy_b]-E[self.energy_bp])
+        return 0
+
+
+def get_plan(self, make_plan):
+    """
+    Returns the assembly plan made by make_plan(si), which is stored in self.si.plans.
+
+    Parameters
+    ----------
+    self : Approach
+        Approach object.
+    make_plan : function
+        Function making the plan for given StateIndexingDM object.
+
+    self.si.plans : dict
+        (Modifies) Dictionary of assembly plans. It is cleared when the indexing changes.
+    """
+    si = self.si
+    key = (make_plan.__name__, si.nleads)
+    if key not in si.plans:
+        si.plans[key] = make_plan(si).finalize()
+    return si.plans[key]
+
+
+def add_dm0_entries(plan, si, bbp, bbpi, bbpi_bool, aap, aapi, aap_sgn, fct):
+    """
+    Adds the kernel entries coupling the equation for the density matrix element bbp
+    to the element aap through the factor fct. Off-diagonal elements are separated into
+    real and imaginary parts with indices bbp, bbpi and aap, aapi.
+    """
+    plan.add_entry(bbp, aap, fct, im=1)
+    if aapi >= si.ndm0:
+        plan.add_entry(bbp, aapi, fct, re=aap_sgn)
+        if bbpi_bool:
+            plan.add_entry(bbpi, aapi, fct, im=aap_sgn)
+    if bbpi_bool:
+        plan.add_entry(bbpi, aap, fct, re=-1)
@@ -0,0 +1,18 @@
+import numpy as np
+cimport numpy as np
+
+ctypedef np.int64_t long_t
+ctypedef np.float64_t double_t
+
+cdef class KernelHandler:
+    cdef public object appr
+    cdef public long_t length
+    cdef public bint sparseq
+    cdef double_t [:, :] kern
+    cdef long_t [:] rows
+    cdef long_t [:] cols
+    cdef double_t [:] vals
+    cdef long_t nnz
+
+    cdef void add(self, long_t i, long_t j, double_t val) except *
+    cdef void grow(self) except *
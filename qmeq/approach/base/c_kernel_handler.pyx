@@ -0,0 +1,58 @@
+"""Module containing cython class, which collects the entries of master equation kernel.
+   For docstrings see documentation of module kernel_handler."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import numpy as np
+from scipy import sparse
+
+from ...mytypes import doublenp
+from ...mytypes import longnp
+
+cimport numpy as np
+cimport cython
+
+
+cdef class KernelHandler:
+
+    def __init__(self, appr, long_t length):
+        self.appr = appr
+        self.length = length
+        self.sparseq = appr.get_sparseq()
+        self.nnz = 0
+        if self.sparseq:
+            appr.kern_ext, appr.kern = None, None
+            self.rows = np.zeros(4*length+1, dtype=longnp)
+            self.cols = np.zeros(4*length+1, dtype=longnp)
+            self.vals = np.zeros(4*length+1, dtype=doublenp)
+        else:
+            appr.kern_ext = np.zeros((length+1, length), dtype=doublenp)
+            appr.kern = appr.kern_ext[0:-1, :]
+            self.kern = appr.kern
+
+    @cython.boundscheck(False)
+    cdef void add(self, long_t i, long_t j, double_t val) except *:
+        if self.sparseq:
+            if self.nnz == self.vals.shape[0]:
+                self.grow()
+            self.rows[self.nnz] = i
+            self.cols[self.nnz] = j
+            self.vals[self.nnz] = val
+            self.nnz += 1
+        else:
+            self.kern[i, j] += val
+
+    cdef void grow(self) except *:
+        cdef long_t size = 2*self.vals.shape[0]
+        self.rows = np.resize(np.asarray(self.rows), size)
+        self.cols = np.resize(np.asarray(self.cols), size)
+        self.vals = np.resize(np.asarray(self.vals), size)
+
+    def finalize(self):
+        if self.sparseq:
+            rows = np.asarray(self.rows)[0:self.nnz]
+            cols = np.asarray(self.cols)[0:self.nnz]
+            vals = np.asarray(self.vals)[0:self.nnz]
+            self.appr.kern = sparse.csr_matrix((vals, (rows, cols)), shape=(self.length, self.length))
+        return 0
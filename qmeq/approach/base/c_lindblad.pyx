@@ -12,6 +12,7 @@ from ...mytypes import complexnp
 
 from ...specfunc.c_specfunc cimport func_pauli
 from ...aprclass import Approach
+from .c_kernel_handler cimport KernelHandler
 from .c_pauli import generate_norm_vec
 
 cimport numpy as np
@@ -90,11 +91,9 @@ def generate_kern_lindblad(self):
     #
     ndm0r, ndm0, npauli, nleads = si.ndm0r, si.ndm0, si.npauli, si.nleads
 
-    self.kern_ext = np.zeros((ndm0r+1, ndm0r), dtype=doublenp)
-    self.kern = self.kern_ext[0:-1, :]
+    cdef KernelHandler kh = KernelHandler(self, ndm0r)
 
     generate_norm_vec(self, ndm0r)
-    cdef np.ndarray[double_t, ndim=2] kern = self.kern
     for charge in range(si.ncharge):
         acharge = charge-1
         bcharge = charge
@@ -106,8 +105,8 @@ def generate_kern_lindblad(self):
                 bbpi = ndm0 + bbp - npauli
                 bbpi_bool = True if bbpi >= ndm0 else False
                 if bbpi_bool:
-                    kern[bbp, bbpi] = kern[bbp, bbpi] + E[b]-E[bp]
-                    kern[bbpi, bbp] = kern[bbpi, bbp] + E[bp]-E[b]
+                    kh.add(bbp, bbpi, E[b]-E[bp])
+                    kh.add(bbpi, bbp, E[bp]-E[b])
                 # --------------------------------------------------
                 for a, ap in itertools.product(si.statesdm[acharge], si.statesdm[acharge]):
                     aap = mapdm0[lenlst[acharge]*dictdm[a] + dictdm[ap] + shiftlst0[acharge]]
@@ -117,13 +116,13 @@ def generate_kern_lindblad(self):
                             fct_aap += tLba[l, b, a]*tLba[l, bp, ap].conjugate()
                         aapi = ndm0 + aap - npauli
                         aap_sgn = +1 if conjdm0[lenlst[acharge]*dictdm[a] + dictdm[ap] + shiftlst0[acharge]] else -1
-                        kern[bbp, aap] = kern[bbp, aap] + fct_aap.real
+                        kh.add(bbp, aap, fct_aap.real)
                         if aapi >= ndm0:
-                            kern[bbp, aapi] = kern[bbp, aapi] - fct_aap.imag*aap_sgn
+                            kh.add(bbp, aapi, -fct_aap.imag*aap_sgn)
                             if bbpi_bool:
-                                kern[bbpi, aapi] = kern[bbpi, aapi] + fct_aap.real*aap_sgn
+                                kh.add(bbpi, aapi, fct_aap.real*aap_sgn)
                         if bbpi_bool:
-                            kern[bbpi, aap] = kern[bbpi, aap] + fct_aap.imag
+                            kh.add(bbpi, aap, fct_aap.imag)
                 # --------------------------------------------------
                 for bpp in si.statesdm[bcharge]:
                     bppbp = mapdm0[lenlst[bcharge]*dictdm[bpp] + dictdm[bp] + shiftlst0[bcharge]]
@@ -137,13 +136,13 @@ def generate_kern_lindblad(self):
                                 fct_bppbp += -0.5*tLba[l, c, b].conjugate()*tLba[l, c, bpp]
                         bppbpi = ndm0 + bppbp - npauli
                         bppbp_sgn = +1 if conjdm0[lenlst[bcharge]*dictdm[bpp] + dictdm[bp] + shiftlst0[bcharge]] else -1
-                        kern[bbp, bppbp] = kern[bbp, bppbp] + fct_bppbp.real
+                        kh.add(bbp, bppbp, fct_bppbp.real)
                         if bppbpi >= ndm0:
-                            kern[bbp, bppbpi] = kern[bbp, bppbpi] - fct_bppbp.imag*bppbp_sgn
+                            kh.add(bbp, bppbpi, -fct_bppbp.imag*bppbp_sgn)
                             if bbpi_bool:
-                                kern[bbpi, bppbpi] = kern[bbpi, bppbpi] + fct_bppbp.real*bppbp_sgn
+                                kh.add(bbpi, bppbpi, fct_bppbp.real*bppbp_sgn)
                         if bbpi_bool:
-                            kern[bbpi, bppbp] = kern[bbpi, bppbp] + fct_bppbp.imag
+                            kh.add(bbpi, bppbp, fct_bppbp.imag)
                     # --------------------------------------------------
                     bbpp = mapdm0[lenlst[bcharge]*dictdm[b] + dictdm[bpp] + shiftlst0[bcharge]]
                     if bbpp != -1:
@@ -156,13 +155,13 @@ def generate_kern_lindblad(self):
                                 fct_bbpp += -0.5*tLba[l, c, bpp].conjugate()*tLba[l, c, bp]
                         bbppi = ndm0 + bbpp - npauli
                         bbpp_sgn = +1 if conjdm0[lenlst[bcharge]*dictdm[b] + dictdm[bpp] + shiftlst0[bcharge]] else -1
-                        kern[bbp, bbpp] = kern[bbp, bbpp] + fct_bbpp.real
+                        kh.add(bbp, bbpp, fct_bbpp.real)
                         if bbppi >= ndm0:
-                            kern[bbp, bbppi] = kern[bbp, bbppi] - fct_bbpp.imag*bbpp_sgn
+                            kh.add(bbp, bbppi, -fct_bbpp.imag*bbpp_sgn)
                             if bbpi_bool:
-                                kern[bbpi, bbppi] = kern[bbpi, bbppi] + fct_bbpp.real*bbpp_sgn
+                                kh.add(bbpi, bbppi, fct_bbpp.real*bbpp_sgn)
                         if bbpi_bool:
-                            kern[bbpi, bbpp] = kern[bbpi, bbpp] + fct_bbpp.imag
+                            kh.add(bbpi, bbpp, fct_bbpp.imag)
                 # --------------------------------------------------
                 for c, cp in itertools.product(si.statesdm[ccharge], si.statesdm[ccharge]):
                     ccp = mapdm0[lenlst[ccharge]*dictdm[c] + dictdm[cp] + shiftlst0[ccharge]]
@@ -172,14 +171,15 @@ def generate_kern_lindblad(self):
                             fct_ccp += tLba[l, b, c]*tLba[l, bp, cp].conjugate()
                         ccpi = ndm0 + ccp - npauli
                         ccp_sgn = +1 if conjdm0[lenlst[ccharge]*dictdm[c] + dictdm[cp] + shiftlst0[ccharge]] else -1
-                        kern[bbp, ccp] = kern[bbp, ccp] + fct_ccp.real
+                        kh.add(bbp, ccp, fct_ccp.real)
                         if ccpi >= ndm0:
-                            kern[bbp, ccpi] = kern[bbp, ccpi] - fct_ccp.imag*ccp_sgn
+                            kh.add(bbp, ccpi, -fct_ccp.imag*ccp_sgn)
                             if bbpi_bool:
-                                kern[bbpi, ccpi] = kern[bbpi, ccpi] + fct_ccp.real*ccp_sgn
+                                kh.add(bbpi, ccpi, fct_ccp.real*ccp_sgn)
                         if bbpi_bool:
-                            kern[bbpi, ccp] = kern[bbpi, ccp] + fct_ccp.imag
+                            kh.add(bbpi, ccp, fct_ccp.imag)
                 # --------------------------------------------------
+    kh.finalize()
     return 0
 
 
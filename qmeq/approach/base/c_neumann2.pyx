@@ -7,22 +7,29 @@ from __future__ import print_function
 import numpy as np
 import itertools
 
-from ...specfunc.specfunc import kernel_fredriksen
-from ...specfunc.specfunc import hilbert_fredriksen
 from .neumann2 import get_emin_emax
 from .neumann2 import get_grid_ext
 from .neumann2 import get_htransf_phi1k
-from .neumann2 import get_htransf_fk
+from .neumann2 import get_fk_2vN
+from .neumann2 import get_grid_htransf
+from .neumann2 import get_trapz_weights
+from .neumann2 import phi1k_local_2vN_array
+from .neumann2 import get_kern1_blocks
+from .neumann2 import make_plan_iterate_2vN
+from .assembly_plan import get_plan
 from .neumann2 import kern_phi0_2vN
 from .neumann2 import generate_current_2vN
 
 from ...mytypes import doublenp
 from ...mytypes import complexnp
+from ...mytypes import longnp
 
 from ...aprclass import ApproachBase2vN
 
 cimport numpy as np
 cimport cython
+from cython.parallel cimport prange, parallel
+from libc.stdlib cimport malloc, free
 
 ctypedef np.uint8_t bool_t
 ctypedef np.int_t int_t
@@ -30,11 +37,34 @@ ctypedef np.int64_t long_t
 ctypedef np.float64_t double_t
 ctypedef np.complex128_t complex_t
 
+# Storage type of the energy resolved arrays
+ctypedef fused storage_t:
+    np.complex64_t
+    np.complex128_t
+
 # from scipy import pi as scipy_pi
 # cdef double_t pi = scipy_pi
 cdef double_t pi = 3.14159265358979323846
 
 
+@cython.cdivision(True)
+cdef inline long_t grid_index(const double_t* grid, long_t n, double_t x, bint uniform) nogil:
+    # Returns the index b_idx of the grid point, for which grid[b_idx-1] <= x < grid[b_idx].
+    # For non-equidistant grid binary search is used
+    cdef long_t lo, hi, mid
+    if uniform:
+        lo = (<long_t>((x-grid[0])/(grid[1]-grid[0])))+1
+    else:
+        lo, hi = 1, n
+        while lo < hi:
+            mid = (lo+hi)//2
+            if grid[mid] <= x:
+                lo = mid+1
+            else:
+                hi = mid
+    return lo if lo < n else n-1
+
+
 @cython.cdivision(True)
 @cython.boundscheck(False)
 cdef complex_t func_2vN(double_t Ek,
@@ -48,9 +78,7 @@ cdef complex_t func_2vN(double_t Ek,
     if Ek<Ek_grid[0] or Ek>Ek_grid[-1]:
         return 0
     #
-    b_idx = (<long_t>((Ek-Ek_grid[0])/(Ek_grid[1]-Ek_grid[0])))+1
-    #if b_idx == len(Ek_grid): b_idx -= 1
-    if b_idx == Ek_grid.shape[0]: b_idx -= 1
+    b_idx = grid_index(&Ek_grid[0], Ek_grid.shape[0], Ek, False)
     a_idx = b_idx - 1
     b, a = Ek_grid[b_idx], Ek_grid[a_idx]
     #
@@ -80,10 +108,7 @@ cdef int_t get_at_k1(double_t Ek,
     if Ek<Ek_grid[0] or Ek>Ek_grid[-1]:
         return 0
     #
-    b_idx = (<long_t>((Ek-Ek_grid[0])/(Ek_grid[1]-Ek_grid[0])))+1
-    # NOTE This line needs to be optimized
-    # if b_idx == len(Ek_grid): b_idx -= 1
-    if b_idx == Ek_grid.shape[0]: b_idx -= 1
+    b_idx = grid_index(&Ek_grid[0], Ek_grid.shape[0], Ek, False)
     a_idx = b_idx - 1
     b, a = Ek_grid[b_idx], Ek_grid[a_idx]
     #
@@ -293,37 +318,230 @@ def phi1k_iterate_2vN(long_t ind,
     return kern0
 
 
+@cython.cdivision(True)
 @cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void kern1_lu_solve_point(long_t j1,
+                               const storage_t[:, ::1] kern1k_lu,
+                               const long_t[:, ::1] kern1k_piv,
+                               const long_t[::1] blk_row,
+                               const long_t[::1] blk_diag,
+                               const long_t[::1] blk_low,
+                               const long_t[::1] blk_up,
+                               complex_t* x,
+                               long_t ncol) nogil:
+    # Solves L1(k)x = b in place using the packed block LU factors, see neumann2.kern1_lu_solve_2vN.
+    # The right hand sides are stored row-major in x with ncol columns
+    cdef long_t nblk = blk_diag.shape[0]
+    cdef long_t i, j, r, s, p, col, r0, n, m0, m
+    cdef complex_t fct, tmp
+    # Forward elimination of the blocks and solution with the Schur complements
+    for i in range(nblk):
+        r0, n = blk_row[i], blk_row[i+1]-blk_row[i]
+        if i > 0:
+            m0, m = blk_row[i-1], blk_row[i]-blk_row[i-1]
+            for r in range(n):
+                for s in range(m):
+                    fct = kern1k_lu[j1, blk_low[i]+r*m+s]
+                    for col in range(ncol):
+                        x[(r0+r)*ncol+col] = x[(r0+r)*ncol+col] - fct*x[(m0+s)*ncol+col]
+        for j in range(n):
+            p = kern1k_piv[j1, r0+j]
+            if p != j:
+                for col in range(ncol):
+                    tmp = x[(r0+j)*ncol+col]
+                    x[(r0+j)*ncol+col] = x[(r0+p)*ncol+col]
+                    x[(r0+p)*ncol+col] = tmp
+        for j in range(n):
+            for r in range(j+1, n):
+                fct = kern1k_lu[j1, blk_diag[i]+r*n+j]
+                for col in range(ncol):
+                    x[(r0+r)*ncol+col] = x[(r0+r)*ncol+col] - fct*x[(r0+j)*ncol+col]
+        for j in range(n-1, -1, -1):
+            fct = kern1k_lu[j1, blk_diag[i]+j*n+j]
+            for col in range(ncol):
+                x[(r0+j)*ncol+col] = x[(r0+j)*ncol+col]/fct
+            for r in range(j):
+                fct = kern1k_lu[j1, blk_diag[i]+r*n+j]
+                for col in range(ncol):
+                    x[(r0+r)*ncol+col] = x[(r0+r)*ncol+col] - fct*x[(r0+j)*ncol+col]
+    # Back substitution
+    for i in range(nblk-2, -1, -1):
+        r0, n = blk_row[i], blk_row[i+1]-blk_row[i]
+        m0, m = blk_row[i+1], blk_row[i+2]-blk_row[i+1]
+        for r in range(n):
+            for s in range(m):
+                fct = kern1k_lu[j1, blk_up[i]+r*m+s]
+                for col in range(ncol):
+                    x[(r0+r)*ncol+col] = x[(r0+r)*ncol+col] - fct*x[(m0+s)*ncol+col]
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void phi1k_iterate_point(long_t j1,
+                              long_t ind,
+                              const double_t[::1] Ek_grid,
+                              bint uniform,
+                              const storage_t[:, :, :, ::1] phi1k,
+                              const storage_t[:, :, :, ::1] hphi1k,
+                              const double_t[:, ::1] fk,
+                              const storage_t[:, ::1] kern1k_lu,
+                              const long_t[:, ::1] kern1k_piv,
+                              const long_t[::1] blk_row,
+                              const long_t[::1] blk_diag,
+                              const long_t[::1] blk_low,
+                              const long_t[::1] blk_up,
+                              const complex_t[::1] term_val,
+                              const long_t[::1] term_row,
+                              const long_t[::1] term_l1,
+                              const long_t[::1] term_cb,
+                              const long_t[::1] term_fk,
+                              const long_t[::1] term_sgn,
+                              const double_t[::1] term_dE,
+                              complex_t* term,
+                              storage_t[:, :, :, ::1] phi1k_delta) nogil:
+    cdef long_t t, i, b_idx, a_idx, l, l1, cb, src, bbp, row
+    cdef long_t nleads = phi1k_delta.shape[1], ndm1 = phi1k_delta.shape[2], ndm0 = phi1k_delta.shape[3]
+    cdef long_t Eklen_ext = Ek_grid.shape[0]
+    cdef double_t Ek = Ek_grid[ind]
+    cdef double_t x, a, b
+    cdef complex_t fct, fa, fb, u, hu
+    for i in range(nleads*ndm1*ndm0):
+        term[i] = 0
+    for t in range(term_val.shape[0]):
+        x = term_sgn[t]*(Ek-term_dE[t])
+        if x < Ek_grid[0] or x > Ek_grid[Eklen_ext-1]:
+            continue
+        b_idx = grid_index(&Ek_grid[0], Eklen_ext, x, uniform)
+        a_idx = b_idx - 1
+        b, a = Ek_grid[b_idx], Ek_grid[a_idx]
+        fct = pi*term_val[t]*fk[term_fk[t], ind]
+        (l1, src, row) = (term_l1[t], term_cb[t], term_row[t]*ndm0)
+        for bbp in range(ndm0):
+            fa = phi1k[a_idx, l1, src, bbp]
+            fb = phi1k[b_idx, l1, src, bbp]
+            u = x/(b-a)*(fb-fa) + 1/(b-a)*(b*fa-a*fb)
+            fa = hphi1k[a_idx, l1, src, bbp]
+            fb = hphi1k[b_idx, l1, src, bbp]
+            hu = x/(b-a)*(fb-fa) + 1/(b-a)*(b*fa-a*fb)
+            if term_sgn[t] == 1:
+                term[row+bbp] = term[row+bbp] + fct*(hu.conjugate()-1j*u.conjugate())
+            else:
+                term[row+bbp] = term[row+bbp] + fct*(hu+1j*u)
+    # Solve with the local kernel L1(k), which is the same for all leads
+    for l in range(nleads):
+        kern1_lu_solve_point(j1, kern1k_lu, kern1k_piv, blk_row, blk_diag, blk_low, blk_up,
+                             &term[l*ndm1*ndm0], ndm0)
+        for cb in range(ndm1):
+            for bbp in range(ndm0):
+                phi1k_delta[j1, l, cb, bbp] = term[(l*ndm1+cb)*ndm0+bbp]
+
+
+@cython.boundscheck(False)
+def phi1k_iterate_grid(const storage_t[:, :, :, ::1] phi1k,
+                       const storage_t[:, :, :, ::1] hphi1k,
+                       const storage_t[:, ::1] kern1k_lu,
+                       const long_t[:, ::1] kern1k_piv,
+                       const long_t[::1] blk_row,
+                       const long_t[::1] blk_diag,
+                       const long_t[::1] blk_low,
+                       const long_t[::1] blk_up,
+                       storage_t[:, :, :, ::1] phi1k_delta,
+                       const double_t[::1] Ek_grid,
+                       const double_t[:, ::1] fk,
+                       const complex_t[::1] term_val,
+                       const long_t[::1] term_row,
+                       const long_t[::1] term_l1,
+                       const long_t[::1] term_cb,
+                       const long_t[::1] term_fk,
+                       const long_t[::1] term_sgn,
+                       const double_t[::1] term_dE,
+                       long_t kpnt_left,
+                       bint uniform,
+                       int nthreads):
+    cdef long_t j1
+    cdef long_t Eklen = phi1k_delta.shape[0]
+    cdef long_t length = phi1k_delta.shape[1]*phi1k_delta.shape[2]*phi1k_delta.shape[3]
+    cdef complex_t* term
+    # Shared flag written through a pointer, because variables assigned in a parallel block are thread-private
+    cdef int failed = 0
+    cdef int* failed_ptr = &failed
+    with nogil, parallel(num_threads=nthreads):
+        # Thread-local buffer for the terms of Phi[1](k)
+        term = <complex_t*> malloc(sizeof(complex_t)*(length+1))
+        if term == NULL:
+            failed_ptr[0] = 1
+        for j1 in prange(Eklen, schedule='static'):
+            if term != NULL:
+                phi1k_iterate_point(j1, j1+kpnt_left, Ek_grid, uniform, phi1k, hphi1k, fk,
+                                    kern1k_lu, kern1k_piv, blk_row, blk_diag, blk_low, blk_up, term_val, term_row, term_l1, term_cb, term_fk, term_sgn, term_dE,
+                                    term, phi1k_delta)
+        free(term)
+    if failed:
+        raise MemoryError('Failed to allocate the buffer for the terms of Phi[1](k)')
+
+
+def phi1k_iterate_2vN_parallel(self, phi1k, hphi1k):
+    """
+    Iterates the 2vN integral equation for all points of Ek_grid, which are distributed
+    among funcp.nthreads OpenMP threads. The terms of phi1k_iterate_2vN are taken from
+    the plan stored in self.si.plans.
+
+    Parameters
+    ----------
+    self : Approach2vN
+        Approach2vN object.
+    phi1k : ndarray
+        Numpy array with dimensions (len(Ek_grid_ext), nleads, ndm1, ndm0)
+        containing difference from phi1k after performing one iteration.
+    hphi1k : ndarray
+        Numpy array with dimensions (len(Ek_grid_ext), nleads, ndm1, ndm0)
+        Hilbert transform of phi1k.
+
+    Returns
+    -------
+    phi1k_delta : ndarray
+        Numpy array with dimensions (len(Ek_grid), nleads, ndm1, ndm0)
+        Correction to Phi[1](k) after an iteration, which has the same type as phi1k.
+    """
+    (E, Tba, si, funcp) = (self.qd.Ea, self.leads.Tba, self.si, self.funcp)
+    plan = get_plan(self, make_plan_iterate_2vN)
+    mtype = phi1k.dtype
+    (kern1k_lu, kern1k_piv) = self.kern1k_lu
+    blk_row, blk_diag, blk_low, blk_up, size = get_kern1_blocks(si)
+    phi1k_delta = np.zeros((self.Ek_grid.shape[0], si.nleads, si.ndm1, si.ndm0), dtype=mtype)
+    phi1k_iterate_grid(np.ascontiguousarray(phi1k),
+                       np.ascontiguousarray(hphi1k, dtype=mtype),
+                       np.ascontiguousarray(kern1k_lu, dtype=mtype),
+                       np.ascontiguousarray(kern1k_piv, dtype=longnp),
+                       blk_row, blk_diag, blk_low, blk_up,
+                       phi1k_delta,
+                       np.ascontiguousarray(self.Ek_grid_ext, dtype=doublenp),
+                       np.concatenate((self.fkp, self.fkm)),
+                       np.ascontiguousarray(plan.get_term_values([Tba, Tba]), dtype=complexnp),
+                       np.ascontiguousarray(plan.term_fct, dtype=longnp),
+                       np.ascontiguousarray(plan.term_src // si.ndm1, dtype=longnp),
+                       np.ascontiguousarray(plan.term_src % si.ndm1, dtype=longnp),
+                       np.ascontiguousarray(plan.term_ind[2], dtype=longnp),
+                       np.ascontiguousarray(plan.term_sgn, dtype=longnp),
+                       np.ascontiguousarray(E[plan.term_e1]-E[plan.term_e2], dtype=doublenp),
+                       funcp.kpnt_left, funcp.grid_2vN == 'uniform', max(funcp.nthreads, 1))
+    return phi1k_delta
+
+
 def get_phi1_phi0_2vN(self):
-    cdef long_t j1, Eklen
-    cdef double_t dx
-    cdef np.ndarray[double_t, ndim=1] Ek_grid = self.Ek_grid
-    #
-    (phi1k, si) = (self.phi1k, self.si)
+    (phi1k, Ek_grid) = (self.phi1k, self.Ek_grid)
     # Get integrated Phi[1]_{cb} in terms of Phi[0]_{bb'}
-    # cdef np.ndarray[complex_t, ndim=3]
-    phi1_phi0 = np.zeros((si.nleads, si.ndm1, si.ndm0), dtype=complexnp)
-    e_phi1_phi0 = np.zeros((si.nleads, si.ndm1, si.ndm0), dtype=complexnp)
-    Eklen = Ek_grid.shape[0]  # len(Ek_grid)
-    #
-    for j1 in range(Eklen):
-        # Trapezoidal rule
-        if j1 == 0:
-          dx = Ek_grid[j1+1] - Ek_grid[j1]
-        elif j1 == Eklen-1:
-          dx = Ek_grid[j1] - Ek_grid[j1-1]
-        else:
-          dx = Ek_grid[j1+1] - Ek_grid[j1-1]
-        phi1_phi0 += 0.5*dx*phi1k[j1]
-        e_phi1_phi0 += 0.5*dx*Ek_grid[j1]*phi1k[j1]
-    self.phi1_phi0 = phi1_phi0
-    self.e_phi1_phi0 = e_phi1_phi0
+    weights = get_trapz_weights(Ek_grid)
+    self.phi1_phi0 = np.tensordot(weights, phi1k, axes=1).astype(complexnp)
+    self.e_phi1_phi0 = np.tensordot(weights*Ek_grid, phi1k, axes=1).astype(complexnp)
     return 0
 
 
 @cython.boundscheck(False)
 def iterate_2vN(self):
-    cdef long_t j1, Eklen, ind, kpnt_left
+    cdef long_t Eklen
     cdef np.ndarray[double_t, ndim=1] Ek_grid = self.Ek_grid
     # cdef np.ndarray[double_t, ndim=1] Ek_grid_ext = self.Ek_grid_ext
     cdef np.ndarray[double_t, ndim=1] E = self.qd.Ea
@@ -331,10 +549,9 @@ def iterate_2vN(self):
     #
     (Ek_grid_ext) = (self.Ek_grid_ext)
     (si, funcp) = (self.si, self.funcp)
-    (mulst, tlst) = (self.leads.mulst, self.leads.tlst)
     # Assign self.phi1k_delta to phi1k_delta_old, because the new phi1k_delta
     # will be generated in this function
-    (phi1k_delta_old, kern1k_inv) = (self.phi1k_delta, self.kern1k_inv)
+    (phi1k_delta_old, kern1k_lu) = (self.phi1k_delta, self.kern1k_lu)
     #
     Eklen = Ek_grid.shape[0]  # len(Ek_grid)
     if phi1k_delta_old is None:
@@ -343,41 +560,24 @@ def iterate_2vN(self):
         get_emin_emax(self)
         # Here self.Ek_grid_ext, self.funcp.kpnt_left, self.funcp.kpnt_right are defined
         get_grid_ext(self)
-        Ek_grid_ext = self.Ek_grid_ext
-        Eklen_ext = Ek_grid_ext.shape[0]  # len(Ek_grid_ext)
         # Generate the Fermi functions on the grid
-        # This is necessary to generate only if Ek_grid, mulst, or tlst are changed
-        self.fkp = np.zeros((si.nleads, Eklen), dtype=doublenp)
-        for l in range(si.nleads):
-            self.fkp[l] = 1/( np.exp((Ek_grid - mulst[l])/tlst[l]) + 1 )
-        self.fkm = 1-self.fkp
-        self.fkp, self.hfkp = get_htransf_fk(self.fkp, funcp)
-        self.fkm, self.hfkm = get_htransf_fk(self.fkm, funcp)
+        # They are generated only if Ek_grid_ext, mulst, or tlst are changed
+        get_fk_2vN(self)
         # Calculate the zeroth iteration of Phi[1](k)
-        phi1k_delta = np.zeros((Eklen, si.nleads, si.ndm1, si.ndm0), dtype=complexnp)
-        kern1k_inv = np.zeros((Eklen, si.nleads, si.ndm1, si.ndm1), dtype=complexnp)
-        kpnt_left = funcp.kpnt_left
-        for j1 in range(Eklen):
-            ind = j1 + kpnt_left
-            phi1k_delta[j1], kern1k_inv[j1] = phi1k_local_2vN(ind, Ek_grid_ext, self.fkp,
-                                                              self.hfkp, self.hfkm, E, Tba, si)
+        phi1k_delta, kern1k_lu = phi1k_local_2vN_array(self)
         hphi1k_delta = None
-    elif kern1k_inv is None:
+    elif kern1k_lu is None:
         pass
     else:
         # Hilbert transform phi1k_delta_old on extended grid Ek_grid_ext
         # print('Hilbert transforming')
-        phi1k_delta_old, hphi1k_delta = get_htransf_phi1k(phi1k_delta_old, funcp)
+        phi1k_delta_old, hphi1k_delta = get_htransf_phi1k(phi1k_delta_old, funcp, self.hphi1k_delta,
+                                                          get_grid_htransf(self))
         # print('Making an iteration')
-        phi1k_delta = np.zeros((Eklen, si.nleads, si.ndm1, si.ndm0), dtype=complexnp)
-        kpnt_left = funcp.kpnt_left
-        for j1 in range(Eklen):
-            ind = j1 + kpnt_left
-            phi1k_delta[j1] = phi1k_iterate_2vN(ind, Ek_grid_ext, phi1k_delta_old, hphi1k_delta,
-                                                self.fkp, kern1k_inv[j1], E, Tba, si)
+        phi1k_delta = phi1k_iterate_2vN_parallel(self, phi1k_delta_old, hphi1k_delta)
     self.phi1k_delta = phi1k_delta
     self.hphi1k_delta = hphi1k_delta
-    self.kern1k_inv = kern1k_inv
+    self.kern1k_lu = kern1k_lu
     return 0
 
 
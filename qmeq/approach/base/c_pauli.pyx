@@ -12,6 +12,11 @@ from ...mytypes import complexnp
 
 from ...specfunc.c_specfunc cimport func_pauli
 from ...aprclass import Approach
+from .c_kernel_handler cimport KernelHandler
+from .pauli import generate_kern_pauli_block
+from .pauli import generate_paulifct_batch
+from .pauli import generate_kern_pauli_batch
+from .pauli import generate_current_pauli_batch
 
 cimport numpy as np
 cimport cython
@@ -108,11 +113,9 @@ def generate_kern_pauli(self):
     cdef np.ndarray[long_t, ndim=1] mapdm0 = si.mapdm0
     cdef np.ndarray[bool_t, ndim=1] booldm0 = si.booldm0
     #
-    self.kern_ext = np.zeros((npauli+1, npauli), dtype=doublenp)
-    self.kern = self.kern_ext[0:-1, :]
+    cdef KernelHandler kh = KernelHandler(self, npauli)
 
     generate_norm_vec(self, npauli)
-    cdef np.ndarray[double_t, ndim=2] kern = self.kern
     for charge in range(si.ncharge):
         acharge = charge-1
         bcharge = charge
@@ -125,14 +128,15 @@ def generate_kern_pauli(self):
                     aa = mapdm0[lenlst[acharge]*dictdm[a] + dictdm[a] + shiftlst0[acharge]]
                     ba = lenlst[acharge]*dictdm[b] + dictdm[a] + shiftlst1[acharge]
                     for l in range(nleads):
-                        kern[bb, bb] = kern[bb, bb] - paulifct[l, ba, 1]
-                        kern[bb, aa] = kern[bb, aa] + paulifct[l, ba, 0]
+                        kh.add(bb, bb, -paulifct[l, ba, 1])
+                        kh.add(bb, aa, paulifct[l, ba, 0])
                 for c in si.statesdm[charge+1]:
                     cc = mapdm0[lenlst[ccharge]*dictdm[c] + dictdm[c] + shiftlst0[ccharge]]
                     cb = lenlst[bcharge]*dictdm[c] + dictdm[b] + shiftlst1[bcharge]
                     for l in range(nleads):
-                        kern[bb, bb] = kern[bb, bb] - paulifct[l, cb, 0]
-                        kern[bb, cc] = kern[bb, cc] + paulifct[l, cb, 1]
+                        kh.add(bb, bb, -paulifct[l, cb, 0])
+                        kh.add(bb, cc, paulifct[l, cb, 1])
+    kh.finalize()
     return 0
 
 
@@ -226,6 +230,10 @@ class ApproachPauli(Approach):
     kerntype = 'Pauli'
     generate_fct = generate_paulifct
     generate_kern = generate_kern_pauli
+    generate_kern_block = staticmethod(generate_kern_pauli_block)
+    generate_fct_batch = staticmethod(generate_paulifct_batch)
+    generate_kern_batch = staticmethod(generate_kern_pauli_batch)
+    generate_current_batch = staticmethod(generate_current_pauli_batch)
     generate_current = generate_current_pauli
     generate_vec = generate_vec_pauli
 # ---------------------------------------------------------------------------------------------------
@@ -0,0 +1,96 @@
+"""Module containing python class, which collects the entries of master equation kernel."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import numpy as np
+from scipy import sparse
+
+from ...mytypes import doublenp
+from ...mytypes import longnp
+
+
+class KernelHandler(object):
+    """
+    Class for collecting the entries of the kernel (Liouvillian) matrix.
+
+    For dense kernels the entries are added directly to appr.kern. For sparse kernels
+    the entries are collected in coordinate (COO) format and converted to
+    scipy.sparse CSR matrix appr.kern by calling finalize().
+
+    Attributes
+    ----------
+    appr : Approach
+        Approach object.
+    length : int
+        Number of rows and columns of the kernel.
+    sparseq : bool
+        Indicates if the kernel is collected as a sparse matrix.
+    kern : array
+        Kernel matrix, which is modified by add() in the dense case.
+    rows, cols, vals : list
+        Row indices, column indices, and values of the entries added in the sparse case.
+    chunks : list
+        List of tuples (rows, cols, vals) of arrays added by add_array() in the sparse case.
+    """
+
+    def __init__(self, appr, length):
+        """
+        Initialization of the KernelHandler class.
+
+        Parameters
+        ----------
+        appr : Approach
+            Approach object.
+        length : int
+            Number of rows and columns of the kernel.
+
+        appr.kern : array
+            (Modifies) Kernel matrix. Set to zero dense array if sparseq=False.
+        appr.kern_ext : array
+            (Modifies) Same as kern, only with one additional row added.
+        """
+        self.appr = appr
+        self.length = length
+        self.sparseq = appr.get_sparseq()
+        if self.sparseq:
+            appr.kern_ext, appr.kern = None, None
+            self.kern = None
+            self.rows, self.cols, self.vals = [], [], []
+            self.chunks = []
+        else:
+            appr.kern_ext = np.zeros((length+1, length), dtype=doublenp)
+            appr.kern = appr.kern_ext[0:-1, :]
+            self.kern = appr.kern
+
+    def add(self, i, j, val):
+        """Adds val to the (i, j) entry of the kernel."""
+        if self.sparseq:
+            self.rows.append(i)
+            self.cols.append(j)
+            self.vals.append(val)
+        else:
+            self.kern[i, j] += val
+
+    def add_array(self, rows, cols, vals):
+        """Adds the array vals to the entries of the kernel given by the arrays rows and cols."""
+        if self.sparseq:
+            self.chunks.append((rows, cols, vals))
+        else:
+            # Sum the repeated entries and add only to the distinct entries of the kernel
+            flat, inv = np.unique(rows*self.length+cols, return_inverse=True)
+            self.kern[flat // self.length, flat % self.length] += np.bincount(inv, weights=vals)
+
+    def finalize(self):
+        """
+        Makes the kernel available as appr.kern.
+
+        appr.kern : array or scipy.sparse.csr_matrix
+            (Modifies) Kernel matrix in CSR format if sparseq=True.
+        """
+        if self.sparseq:
+            rows = np.concatenate([np.array(self.rows, dtype=longnp)] + [c[0] for c in self.chunks])
+            cols = np.concatenate([np.array(self.cols, dtype=longnp)] + [c[1] for c in self.chunks])
+            vals = np.concatenate([np.array(self.vals, dtype=doublenp)] + [c[2] for c in self.chunks])
+            self.appr.kern = sparse.csr_matrix((vals, (rows, cols)), shape=(self.length, self.length))
+        return 0
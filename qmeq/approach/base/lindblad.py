@@ -11,6 +11,10 @@ from ...mytypes import doublenp
 
 from ...specfunc.specfunc import func_pauli
 from ...aprclass import Approach
+from .kernel_handler import KernelHandler
+from .assembly_plan import AssemblyPlan
+from .assembly_plan import add_dm0_entries
+from .assembly_plan import get_plan
 from .pauli import generate_norm_vec
 
 
@@ -47,110 +51,112 @@ def generate_tLba(self):
     return 0
 
 
-def generate_kern_lindblad(self):
+def make_plan_lindblad(si):
     """
-    Generates a kernel (Liouvillian) matrix corresponding to Lindblad approach.
+    Make the assembly plan of Lindblad kernel. The operands are tLba and tLba.
+    The factors are multiplied by the imaginary unit, so that the kernel entries
+    are given by add_dm0_entries() in the same way as for 1vN approach.
 
     Parameters
     ----------
-    self : Approach
-        Approach object.
+    si : StateIndexingDM
+        StateIndexingDM object.
 
-    self.kern : array
-        (Modifies) Kernel matrix for first-order Lindblad approach.
-    self.bvec : array
-        (Modifies) Right hand side column vector for master equation.
-        The entry funcp.norm_row is 1 representing normalization condition.
+    Returns
+    -------
+    AssemblyPlan
+        Assembly plan of the kernel.
     """
-    (E, tLba, si) = (self.qd.Ea, self.tLba, self.si)
+    plan = AssemblyPlan(si.ndm0r, 2)
+    ndm0, npauli, nmany = si.ndm0, si.npauli, si.nmany
 
-    self.kern_ext = np.zeros((si.ndm0r+1, si.ndm0r), dtype=doublenp)
-    self.kern = self.kern_ext[0:-1, :]
+    def tind(l, b, a):
+        return (l*nmany + b)*nmany + a
 
-    generate_norm_vec(self, si.ndm0r)
-    kern = self.kern
     for charge in range(si.ncharge):
         for b, bp in itertools.combinations_with_replacement(si.statesdm[charge], 2):
             bbp = si.get_ind_dm0(b, bp, charge)
             bbp_bool = si.get_ind_dm0(b, bp, charge, 2)
             if bbp != -1 and bbp_bool:
-                bbpi = si.ndm0 + bbp - si.npauli
-                bbpi_bool = True if bbpi >= si.ndm0 else False
+                bbpi = ndm0 + bbp - npauli
+                bbpi_bool = True if bbpi >= ndm0 else False
                 if bbpi_bool:
-                    kern[bbp, bbpi] += E[b]-E[bp]
-                    kern[bbpi, bbp] += E[bp]-E[b]
+                    plan.add_energy(bbp, bbpi, b, bp)
+                    plan.add_energy(bbpi, bbp, bp, b)
                 # --------------------------------------------------
                 for a, ap in itertools.product(si.statesdm[charge-1], si.statesdm[charge-1]):
                     aap = si.get_ind_dm0(a, ap, charge-1)
                     if aap != -1:
-                        fct_aap = 0
+                        fct_aap = plan.new_fct()
                         for l in range(si.nleads):
-                            fct_aap += tLba[l, b, a]*tLba[l, bp, ap].conjugate()
-                        aapi = si.ndm0 + aap - si.npauli
+                            plan.add_term(fct_aap, [tind(l, b, a), tind(l, bp, ap)], [False, True], 1j)
+                        aapi = ndm0 + aap - npauli
                         aap_sgn = +1 if si.get_ind_dm0(a, ap, charge-1, maptype=3) else -1
-                        kern[bbp, aap] += fct_aap.real
-                        if aapi >= si.ndm0:
-                            kern[bbp, aapi] -= fct_aap.imag*aap_sgn
-                            if bbpi_bool:
-                                kern[bbpi, aapi] += fct_aap.real*aap_sgn
-                        if bbpi_bool:
-                            kern[bbpi, aap] += fct_aap.imag
+                        add_dm0_entries(plan, si, bbp, bbpi, bbpi_bool, aap, aapi, aap_sgn, fct_aap)
                 # --------------------------------------------------
                 for bpp in si.statesdm[charge]:
                     bppbp = si.get_ind_dm0(bpp, bp, charge)
                     if bppbp != -1:
-                        fct_bppbp = 0
+                        fct_bppbp = plan.new_fct()
                         for a in si.statesdm[charge-1]:
                             for l in range(si.nleads):
-                                fct_bppbp += -0.5*tLba[l, a, b].conjugate()*tLba[l, a, bpp]
+                                plan.add_term(fct_bppbp, [tind(l, a, b), tind(l, a, bpp)], [True, False], -0.5j)
                         for c in si.statesdm[charge+1]:
                             for l in range(si.nleads):
-                                fct_bppbp += -0.5*tLba[l, c, b].conjugate()*tLba[l, c, bpp]
-                        bppbpi = si.ndm0 + bppbp - si.npauli
+                                plan.add_term(fct_bppbp, [tind(l, c, b), tind(l, c, bpp)], [True, False], -0.5j)
+                        bppbpi = ndm0 + bppbp - npauli
                         bppbp_sgn = +1 if si.get_ind_dm0(bpp, bp, charge, maptype=3) else -1
-                        kern[bbp, bppbp] += fct_bppbp.real
-                        if bppbpi >= si.ndm0:
-                            kern[bbp, bppbpi] -= fct_bppbp.imag*bppbp_sgn
-                            if bbpi_bool:
-                                kern[bbpi, bppbpi] += fct_bppbp.real*bppbp_sgn
-                        if bbpi_bool:
-                            kern[bbpi, bppbp] += fct_bppbp.imag
+                        add_dm0_entries(plan, si, bbp, bbpi, bbpi_bool, bppbp, bppbpi, bppbp_sgn, fct_bppbp)
                     # --------------------------------------------------
                     bbpp = si.get_ind_dm0(b, bpp, charge)
                     if bbpp != -1:
-                        fct_bbpp = 0
+                        fct_bbpp = plan.new_fct()
                         for a in si.statesdm[charge-1]:
                             for l in range(si.nleads):
-                                fct_bbpp += -0.5*tLba[l, a, bpp].conjugate()*tLba[l, a, bp]
+                                plan.add_term(fct_bbpp, [tind(l, a, bpp), tind(l, a, bp)], [True, False], -0.5j)
                         for c in si.statesdm[charge+1]:
                             for l in range(si.nleads):
-                                fct_bbpp += -0.5*tLba[l, c, bpp].conjugate()*tLba[l, c, bp]
-                        bbppi = si.ndm0 + bbpp - si.npauli
+                                plan.add_term(fct_bbpp, [tind(l, c, bpp), tind(l, c, bp)], [True, False], -0.5j)
+                        bbppi = ndm0 + bbpp - npauli
                         bbpp_sgn = +1 if si.get_ind_dm0(b, bpp, charge, maptype=3) else -1
-                        kern[bbp, bbpp] += fct_bbpp.real
-                        if bbppi >= si.ndm0:
-                            kern[bbp, bbppi] -= fct_bbpp.imag*bbpp_sgn
-                            if bbpi_bool:
-                                kern[bbpi, bbppi] += fct_bbpp.real*bbpp_sgn
-                        if bbpi_bool:
-                            kern[bbpi, bbpp] += fct_bbpp.imag
+                        add_dm0_entries(plan, si, bbp, bbpi, bbpi_bool, bbpp, bbppi, bbpp_sgn, fct_bbpp)
                 # --------------------------------------------------
                 for c, cp in itertools.product(si.statesdm[charge+1], si.statesdm[charge+1]):
                     ccp = si.get_ind_dm0(c, cp, charge+1)
                     if ccp != -1:
-                        fct_ccp = 0
+                        fct_ccp = plan.new_fct()
                         for l in range(si.nleads):
-                            fct_ccp += tLba[l, b, c]*tLba[l, bp, cp].conjugate()
-                        ccpi = si.ndm0 + ccp - si.npauli
+                            plan.add_term(fct_ccp, [tind(l, b, c), tind(l, bp, cp)], [False, True], 1j)
+                        ccpi = ndm0 + ccp - npauli
                         ccp_sgn = +1 if si.get_ind_dm0(c, cp, charge+1, maptype=3) else -1
-                        kern[bbp, ccp] += fct_ccp.real
-                        if ccpi >= si.ndm0:
-                            kern[bbp, ccpi] -= fct_ccp.imag*ccp_sgn
-                            if bbpi_bool:
-                                kern[bbpi, ccpi] += fct_ccp.real*ccp_sgn
-                        if bbpi_bool:
-                            kern[bbpi, ccp] += fct_ccp.imag
+                        add_dm0_entries(plan, si, bbp, bbpi, bbpi_bool, ccp, ccpi, ccp_sgn, fct_ccp)
                 # --------------------------------------------------
+    return plan
+
+
+def generate_kern_lindblad(self):
+    """
+    Generates a kernel (Liouvillian) matrix corresponding to Lindblad approach
+    using the assembly plan stored in self.si.plans.
+
+    Parameters
+    ----------
+    self : Approach
+        Approach object.
+
+    self.kern : array
+        (Modifies) Kernel matrix for first-order Lindblad approach.
+    self.bvec : array
+        (Modifies) Right hand side column vector for master equation.
+        The entry funcp.norm_row is 1 representing normalization condition.
+    """
+    (E, tLba, si) = (self.qd.Ea, self.tLba, self.si)
+
+    kh = KernelHandler(self, si.ndm0r)
+
+    generate_norm_vec(self, si.ndm0r)
+    get_plan(self, make_plan_lindblad).assemble(kh, [tLba, tLba], E)
+    kh.finalize()
     return 0
 
 
@@ -9,14 +9,75 @@ import itertools
 from ...mytypes import complexnp
 from ...mytypes import doublenp
 
-from ...specfunc.specfunc import func_1vN
+from ...specfunc.specfunc import func_1vN_array
 from ...aprclass import Approach
+from .kernel_handler import KernelHandler
+from .assembly_plan import AssemblyPlan
+from .assembly_plan import add_dm0_entries
+from .assembly_plan import get_plan
 from .pauli import generate_norm_vec
 
 
+def get_Ecb(self):
+    """
+    Makes the array of energy differences Ecb=E[c]-E[b] ordered by the index cb.
+
+    Parameters
+    ----------
+    self : Approach
+        Approach object.
+
+    Returns
+    -------
+    array
+        Array of length ndm1 containing the energy differences.
+    """
+    (E, si) = (self.qd.Ea, self.si)
+    Ecb = np.zeros(si.ndm1, dtype=doublenp)
+    for charge in range(si.ncharge-1):
+        statesc, statesb = si.statesdm[charge+1], si.statesdm[charge]
+        if len(statesc) > 0 and len(statesb) > 0:
+            cb = si.get_ind_dm1(statesc[0], statesb[0], charge)
+            Ecb[cb:cb+len(statesc)*len(statesb)] = np.subtract.outer(E[statesc], E[statesb]).ravel()
+    return Ecb
+
+
+def get_pv_integrals(self, Ecb):
+    """
+    Evaluates the principal value integrals needed by func_1vN for itype=0
+    using the tables provided by self.funcp.get_pv_table().
+
+    Parameters
+    ----------
+    self : Approach
+        Approach object.
+    Ecb : array
+        Array of energy differences given by get_Ecb().
+
+    Returns
+    -------
+    array
+        nleads by ndm1 array of the principal value integrals. None if the tables are not
+        used for any lead, so dqawc has to be called for each transition.
+    """
+    (si, mulst, tlst, dlst) = (self.si, self.leads.mulst, self.leads.tlst, self.leads.dlst)
+    tables = []
+    for l in range(si.nleads):
+        ninband = np.count_nonzero((dlst[l, 0] < Ecb) & (Ecb < dlst[l, 1]))
+        tables.append(self.funcp.get_pv_table(mulst[l], tlst[l], dlst[l, 0], dlst[l, 1], ninband))
+    if not any(table.wideq or table.spline is not None for table, reflectq in tables):
+        return None
+    pv = np.zeros((si.nleads, si.ndm1), dtype=doublenp)
+    for l, (table, reflectq) in enumerate(tables):
+        alpha = (Ecb-mulst[l])/tlst[l]
+        pv[l] = table.reflected(alpha) if reflectq else table(alpha)
+    return pv
+
+
 def generate_phi1fct(self):
     """
     Make factors used for generating 1vN, Redfield master equation kernels.
+    The factors for all leads and transitions are obtained by one call of func_1vN_array.
 
     Parameters
     ----------
@@ -28,144 +89,141 @@ def generate_phi1fct(self):
     self.phi1fct_energy : array
         (Modifies) Factors used to calculate energy and heat currents in 1vN, Redfield approaches.
     """
-    (E, si, mulst, tlst, dlst) = (self.qd.Ea, self.si,
-                                  self.leads.mulst, self.leads.tlst, self.leads.dlst)
+    (mulst, tlst, dlst) = (self.leads.mulst, self.leads.tlst, self.leads.dlst)
     (itype, limit) = (self.funcp.itype, self.funcp.dqawc_limit)
-    phi1fct = np.zeros((si.nleads, si.ndm1, 2), dtype=complexnp)
-    phi1fct_energy = np.zeros((si.nleads, si.ndm1, 2), dtype=complexnp)
-    for charge in range(si.ncharge-1):
-        ccharge = charge+1
-        bcharge = charge
-        for c, b in itertools.product(si.statesdm[ccharge], si.statesdm[bcharge]):
-            cb = si.get_ind_dm1(c, b, bcharge)
-            Ecb = E[c]-E[b]
-            for l in range(si.nleads):
-                rez = func_1vN(Ecb, mulst[l], tlst[l], dlst[l, 0], dlst[l, 1], itype, limit)
-                phi1fct[l, cb, 0] = rez[0]
-                phi1fct[l, cb, 1] = rez[1]
-                phi1fct_energy[l, cb, 0] = rez[2]
-                phi1fct_energy[l, cb, 1] = rez[3]
-    self.phi1fct = phi1fct
-    self.phi1fct_energy = phi1fct_energy
+    Ecb = get_Ecb(self)
+    pv = get_pv_integrals(self, Ecb) if itype == 0 and self.funcp.pv_tableq else None
+    rez = func_1vN_array(Ecb, mulst, tlst, dlst[:, 0], dlst[:, 1], itype, limit, pv)
+    self.phi1fct = rez[..., 0:2].copy()
+    self.phi1fct_energy = rez[..., 2:4].copy()
     return 0
 
 
 # ---------------------------------------------------------------------------------------------------
 # 1 von Neumann approach
 # ---------------------------------------------------------------------------------------------------
-def generate_kern_1vN(self):
+def make_plan_1vN(si):
     """
-    Generates a kernel (Liouvillian) matrix corresponding to first order von Neumann approach (1vN).
+    Make the assembly plan of 1vN kernel. The operands are Tba, Tba, and phi1fct.
 
     Parameters
     ----------
-    self : Approach
-        Approach object.
+    si : StateIndexingDM
+        StateIndexingDM object.
 
-    self.kern : array
-        (Modifies) Kernel matrix for 1vN approach.
+    Returns
+    -------
+    AssemblyPlan
+        Assembly plan of the kernel.
     """
-    (E, Tba, phi1fct, si) = (self.qd.Ea, self.leads.Tba, self.phi1fct, self.si)
+    plan = AssemblyPlan(si.ndm0r, 3)
+    ndm0, npauli, nmany = si.ndm0, si.npauli, si.nmany
 
-    self.kern_ext = np.zeros((si.ndm0r+1, si.ndm0r), dtype=doublenp)
-    self.kern = self.kern_ext[0:-1, :]
+    def tind(l, b, a):
+        return (l*nmany + b)*nmany + a
+
+    def find(l, cb, i):
+        return (l*si.ndm1 + cb)*2 + i
 
-    generate_norm_vec(self, si.ndm0r)
-    kern = self.kern
     for charge in range(si.ncharge):
         for b, bp in itertools.combinations_with_replacement(si.statesdm[charge], 2):
             bbp = si.get_ind_dm0(b, bp, charge)
             bbp_bool = si.get_ind_dm0(b, bp, charge, 2)
             if bbp != -1 and bbp_bool:
-                bbpi = si.ndm0 + bbp - si.npauli
-                bbpi_bool = True if bbpi >= si.ndm0 else False
+                bbpi = ndm0 + bbp - npauli
+                bbpi_bool = True if bbpi >= ndm0 else False
                 if bbpi_bool:
-                    kern[bbp, bbpi] += E[b]-E[bp]
-                    kern[bbpi, bbp] += E[bp]-E[b]
+                    plan.add_energy(bbp, bbpi, b, bp)
+                    plan.add_energy(bbpi, bbp, bp, b)
                 # --------------------------------------------------
                 for a, ap in itertools.product(si.statesdm[charge-1], si.statesdm[charge-1]):
                     aap = si.get_ind_dm0(a, ap, charge-1)
                     if aap != -1:
                         bpa = si.get_ind_dm1(bp, a, charge-1)
                         bap = si.get_ind_dm1(b, ap, charge-1)
-                        fct_aap = 0
+                        fct_aap = plan.new_fct()
                         for l in range(si.nleads):
-                            fct_aap += (+ Tba[l, b, a]*Tba[l, ap, bp]*phi1fct[l, bpa, 0].conjugate()
-                                        - Tba[l, b, a]*Tba[l, ap, bp]*phi1fct[l, bap, 0])
-                        aapi = si.ndm0 + aap - si.npauli
+                            plan.add_term(fct_aap, [tind(l, b, a), tind(l, ap, bp), find(l, bpa, 0)],
+                                          [False, False, True], +1)
+                            plan.add_term(fct_aap, [tind(l, b, a), tind(l, ap, bp), find(l, bap, 0)],
+                                          [False, False, False], -1)
+                        aapi = ndm0 + aap - npauli
                         aap_sgn = +1 if si.get_ind_dm0(a, ap, charge-1, maptype=3) else -1
-                        kern[bbp, aap] += fct_aap.imag
-                        if aapi >= si.ndm0:
-                            kern[bbp, aapi] += fct_aap.real*aap_sgn
-                            if bbpi_bool:
-                                kern[bbpi, aapi] += fct_aap.imag*aap_sgn
-                        if bbpi_bool:
-                            kern[bbpi, aap] -= fct_aap.real
+                        add_dm0_entries(plan, si, bbp, bbpi, bbpi_bool, aap, aapi, aap_sgn, fct_aap)
                 # --------------------------------------------------
                 for bpp in si.statesdm[charge]:
                     bppbp = si.get_ind_dm0(bpp, bp, charge)
                     if bppbp != -1:
-                        fct_bppbp = 0
+                        fct_bppbp = plan.new_fct()
                         for a in si.statesdm[charge-1]:
                             bpa = si.get_ind_dm1(bp, a, charge-1)
                             for l in range(si.nleads):
-                                fct_bppbp += (+Tba[l, b, a]*Tba[l, a, bpp]
-                                              * phi1fct[l, bpa, 1].conjugate())
+                                plan.add_term(fct_bppbp, [tind(l, b, a), tind(l, a, bpp), find(l, bpa, 1)],
+                                              [False, False, True], +1)
                         for c in si.statesdm[charge+1]:
                             cbp = si.get_ind_dm1(c, bp, charge)
                             for l in range(si.nleads):
-                                fct_bppbp += +Tba[l, b, c]*Tba[l, c, bpp]*phi1fct[l, cbp, 0]
-                        bppbpi = si.ndm0 + bppbp - si.npauli
+                                plan.add_term(fct_bppbp, [tind(l, b, c), tind(l, c, bpp), find(l, cbp, 0)],
+                                              [False, False, False], +1)
+                        bppbpi = ndm0 + bppbp - npauli
                         bppbp_sgn = +1 if si.get_ind_dm0(bpp, bp, charge, maptype=3) else -1
-                        kern[bbp, bppbp] += fct_bppbp.imag
-                        if bppbpi >= si.ndm0:
-                            kern[bbp, bppbpi] += fct_bppbp.real*bppbp_sgn
-                            if bbpi_bool:
-                                kern[bbpi, bppbpi] += fct_bppbp.imag*bppbp_sgn
-                        if bbpi_bool:
-                            kern[bbpi, bppbp] -= fct_bppbp.real
+                        add_dm0_entries(plan, si, bbp, bbpi, bbpi_bool, bppbp, bppbpi, bppbp_sgn, fct_bppbp)
                     # --------------------------------------------------
                     bbpp = si.get_ind_dm0(b, bpp, charge)
                     if bbpp != -1:
-                        fct_bbpp = 0
+                        fct_bbpp = plan.new_fct()
                         for a in si.statesdm[charge-1]:
                             ba = si.get_ind_dm1(b, a, charge-1)
                             for l in range(si.nleads):
-                                fct_bbpp += -Tba[l, bpp, a]*Tba[l, a, bp]*phi1fct[l, ba, 1]
+                                plan.add_term(fct_bbpp, [tind(l, bpp, a), tind(l, a, bp), find(l, ba, 1)],
+                                              [False, False, False], -1)
                         for c in si.statesdm[charge+1]:
                             cb = si.get_ind_dm1(c, b, charge)
                             for l in range(si.nleads):
-                                fct_bbpp += (-Tba[l, bpp, c]*Tba[l, c, bp]
-                                             * phi1fct[l, cb, 0].conjugate())
-                        bbppi = si.ndm0 + bbpp - si.npauli
+                                plan.add_term(fct_bbpp, [tind(l, bpp, c), tind(l, c, bp), find(l, cb, 0)],
+                                              [False, False, True], -1)
+                        bbppi = ndm0 + bbpp - npauli
                         bbpp_sgn = +1 if si.get_ind_dm0(b, bpp, charge, maptype=3) else -1
-                        kern[bbp, bbpp] += fct_bbpp.imag
-                        if bbppi >= si.ndm0:
-                            kern[bbp, bbppi] += fct_bbpp.real*bbpp_sgn
-                            if bbpi_bool:
-                                kern[bbpi, bbppi] += fct_bbpp.imag*bbpp_sgn
-                        if bbpi_bool:
-                            kern[bbpi, bbpp] -= fct_bbpp.real
+                        add_dm0_entries(plan, si, bbp, bbpi, bbpi_bool, bbpp, bbppi, bbpp_sgn, fct_bbpp)
                 # --------------------------------------------------
                 for c, cp in itertools.product(si.statesdm[charge+1], si.statesdm[charge+1]):
                     ccp = si.get_ind_dm0(c, cp, charge+1)
                     if ccp != -1:
                         cbp = si.get_ind_dm1(c, bp, charge)
                         cpb = si.get_ind_dm1(cp, b, charge)
-                        fct_ccp = 0
+                        fct_ccp = plan.new_fct()
                         for l in range(si.nleads):
-                            fct_ccp += (+ Tba[l, b, c]*Tba[l, cp, bp]*phi1fct[l, cbp, 1]
-                                        - Tba[l, b, c]*Tba[l, cp, bp]*phi1fct[l, cpb, 1].conjugate())
-                        ccpi = si.ndm0 + ccp - si.npauli
+                            plan.add_term(fct_ccp, [tind(l, b, c), tind(l, cp, bp), find(l, cbp, 1)],
+                                          [False, False, False], +1)
+                            plan.add_term(fct_ccp, [tind(l, b, c), tind(l, cp, bp), find(l, cpb, 1)],
+                                          [False, False, True], -1)
+                        ccpi = ndm0 + ccp - npauli
                         ccp_sgn = +1 if si.get_ind_dm0(c, cp, charge+1, maptype=3) else -1
-                        kern[bbp, ccp] += fct_ccp.imag
-                        if ccpi >= si.ndm0:
-                            kern[bbp, ccpi] += fct_ccp.real*ccp_sgn
-                            if bbpi_bool:
-                                kern[bbpi, ccpi] += fct_ccp.imag*ccp_sgn
-                        if bbpi_bool:
-                            kern[bbpi, ccp] -= fct_ccp.real
+                        add_dm0_entries(plan, si, bbp, bbpi, bbpi_bool, ccp, ccpi, ccp_sgn, fct_ccp)
                 # --------------------------------------------------
+    return plan
+
+
+def generate_kern_1vN(self):
+    """
+    Generates a kernel (Liouvillian) matrix corresponding to first order von Neumann approach (1vN)
+    using the assembly plan stored in self.si.plans.
+
+    Parameters
+    ----------
+    self : Approach
+        Approach object.
+
+    self.kern : array
+        (Modifies) Kernel matrix for 1vN approach.
+    """
+    (E, Tba, phi1fct, si) = (self.qd.Ea, self.leads.Tba, self.phi1fct, self.si)
+
+    kh = KernelHandler(self, si.ndm0r)
+
+    generate_norm_vec(self, si.ndm0r)
+    get_plan(self, make_plan_1vN).assemble(kh, [Tba, Tba, phi1fct], E)
+    kh.finalize()
     return 0
 
 
@@ -5,16 +5,19 @@ from __future__ import division
 from __future__ import print_function
 import numpy as np
 from scipy import pi
+from scipy import sparse
 import itertools
 
 from ...mytypes import complexnp
 from ...mytypes import doublenp
-from ...mytypes import intnp
+from ...mytypes import longnp
 
-from ...specfunc.specfunc import kernel_fredriksen
-from ...specfunc.specfunc import hilbert_fredriksen
 from ...aprclass import ApproachBase2vN
 from .pauli import generate_norm_vec
+from .assembly_plan import AssemblyPlan
+from .assembly_plan import get_plan
+from ...solvers import lu_factor_block_tridiag
+from ...solvers import lu_solve_block_tridiag
 
 
 def func_2vN(Ek, Ek_grid, l, eta, hfk):
@@ -42,7 +45,8 @@ def func_2vN(Ek, Ek_grid, l, eta, hfk):
     if Ek < Ek_grid[0] or Ek > Ek_grid[-1]:
         return 0
     #
-    b_idx = int((Ek-Ek_grid[0])/(Ek_grid[1]-Ek_grid[0]))+1
+    # The grid can be non-equidistant
+    b_idx = int(np.searchsorted(Ek_grid, Ek, side='right'))
     if b_idx == len(Ek_grid):
         b_idx -= 1
     a_idx = b_idx - 1
@@ -54,6 +58,42 @@ def func_2vN(Ek, Ek_grid, l, eta, hfk):
     return pi*rez if eta+1 else pi*rez.conjugate()
 
 
+def func_2vN_array(Ek, Ek_grid, l, eta, hfk):
+    """
+    Linearly interpolate the values of hfk on Ek_grid at an array of points Ek.
+    Vectorized version of func_2vN.
+
+    Parameters
+    ----------
+    Ek : ndarray
+        Energy values (not necessarily grid points).
+    Ek_grid : ndarray
+        Energy grid.
+    l : ndarray
+        Row labels of hfk, which are broadcast against Ek.
+    eta : ndarray
+        Integers describing (+/-1) if infinitesimal eta is positive or negative,
+        which are broadcast against Ek.
+    hfk : ndarray
+        Array containing Hilbert transforms of Fermi function (or 1-Fermi) in its rows.
+
+    Returns
+    -------
+    ndarray
+        Interpolated values of hfk at Ek.
+    """
+    inside = np.logical_and(Ek >= Ek_grid[0], Ek <= Ek_grid[-1])
+    b_idx = np.clip(np.searchsorted(Ek_grid, Ek, side='right'), 1, len(Ek_grid)-1)
+    a_idx = b_idx - 1
+    b, a = Ek_grid[b_idx], Ek_grid[a_idx]
+    #
+    fb = hfk[l, b_idx]
+    fa = hfk[l, a_idx]
+    rez = (fb-fa)/(b-a)*Ek + (b*fa-a*fb)/(b-a)
+    rez = np.where(eta+1, rez, rez.conjugate())
+    return np.where(inside, pi*rez, 0)
+
+
 def get_at_k1(Ek, Ek_grid, l, cb, conj, phi1k, hphi1k):
     """
     Linearly interpolate the values of phi1k, hphi1k on Ek_grid at point Ek.
@@ -85,8 +125,7 @@ def get_at_k1(Ek, Ek_grid, l, cb, conj, phi1k, hphi1k):
     if Ek < Ek_grid[0] or Ek > Ek_grid[-1]:
         return 0, 0
     #
-    # b_idx = np.searchsorted(Ek_grid, Ek)
-    b_idx = int((Ek-Ek_grid[0])/(Ek_grid[1]-Ek_grid[0]))+1
+    b_idx = int(np.searchsorted(Ek_grid, Ek, side='right'))
     if b_idx == len(Ek_grid):
         b_idx -= 1
     a_idx = b_idx - 1
@@ -203,6 +242,365 @@ def phi1k_local_2vN(ind, Ek_grid, fk, hfkp, hfkm, E, Tba, si):
     return kern0, kern1_inv
 
 
+def make_plan_local_kern0_2vN(si):
+    """
+    Make the assembly plan of the Phi[0] part L0p(k) of the local approximation kernel.
+    The operands are Tba and the array containing fkp and fkm stacked along the first axis.
+    The factors are the flattened elements of L0p(k) with dimensions (nleads, ndm1, ndm0).
+
+    Parameters
+    ----------
+    si : StateIndexingDM
+        StateIndexingDM object.
+
+    Returns
+    -------
+    AssemblyPlan
+        Assembly plan of the kernel.
+    """
+    (nleads, ndm0, ndm1, nmany) = (si.nleads, si.ndm0, si.ndm1, si.nmany)
+    plan = AssemblyPlan(ndm1, 2)
+    plan.nfct = nleads*ndm1*ndm0
+
+    def tind(l, b, a):
+        return (l*nmany + b)*nmany + a
+
+    for charge in range(si.ncharge-1):
+        ccharge = charge+1
+        bcharge = charge
+        for c, b in itertools.product(si.statesdm[ccharge], si.statesdm[bcharge]):
+            cb = si.get_ind_dm1(c, b, bcharge)
+            for l in range(nleads):
+                for b1 in si.statesdm[bcharge]:
+                    b1b = si.get_ind_dm0(b1, b, bcharge)
+                    plan.add_term((l*ndm1 + cb)*ndm0 + b1b, [tind(l, c, b1), l], None, +1)
+                for c1 in si.statesdm[ccharge]:
+                    cc1 = si.get_ind_dm0(c, c1, ccharge)
+                    plan.add_term((l*ndm1 + cb)*ndm0 + cc1, [tind(l, c1, b), nleads+l], None, -1)
+    return plan
+
+
+def make_plan_local_kern1_2vN(si):
+    """
+    Make the assembly plan of the local approximation kernel L1(k), which does not depend on the lead.
+    The operands are Tba, Tba, and the array of the interpolated Hilbert transforms of the Fermi
+    functions func_2vN(func_sgn*(Ek-E[func_b]+E[func_a]), Ek_grid, func_hfk, func_sgn, hfk), where
+    hfk contains hfkp and hfkm stacked along the first axis. The factors are the flattened
+    elements of L1(k) with dimensions (ndm1, ndm1) without the diagonal Ek-E[diag_c]+E[diag_b].
+
+    Parameters
+    ----------
+    si : StateIndexingDM
+        StateIndexingDM object.
+
+    Returns
+    -------
+    AssemblyPlan
+        Assembly plan of the kernel.
+    """
+    (nleads, ndm1, nmany) = (si.nleads, si.ndm1, si.nmany)
+    plan = AssemblyPlan(ndm1, 3)
+    plan.nfct = ndm1*ndm1
+    funcs = {}
+    diag_c, diag_b = np.zeros(ndm1, dtype=longnp), np.zeros(ndm1, dtype=longnp)
+
+    def tind(l, b, a):
+        return (l*nmany + b)*nmany + a
+
+    def find(sgn, b, a, hfkm, l):
+        return funcs.setdefault((sgn, b, a, hfkm*nleads + l), len(funcs))
+
+    for charge in range(si.ncharge-1):
+        dcharge = charge+2
+        ccharge = charge+1
+        bcharge = charge
+        acharge = charge-1
+        for c, b in itertools.product(si.statesdm[ccharge], si.statesdm[bcharge]):
+            cb = si.get_ind_dm1(c, b, bcharge)
+            diag_c[cb], diag_b[cb] = c, b
+            # 2nd and 7th terms
+            for b1, a1 in itertools.product(si.statesdm[bcharge], si.statesdm[acharge]):
+                b1a1 = si.get_ind_dm1(b1, a1, acharge)
+                for l1 in range(nleads):
+                    ind = [tind(l1, c, b1), tind(l1, a1, b)]
+                    plan.add_term(cb*ndm1 + b1a1, ind + [find(+1, b1, b, 0, l1)], None, -1)
+                    plan.add_term(cb*ndm1 + b1a1, ind + [find(-1, c, a1, 0, l1)], None, +1)
+            # 6th and 8th terms
+            for b1 in si.statesdm[bcharge]:
+                cb1 = si.get_ind_dm1(c, b1, bcharge)
+                for l1 in range(nleads):
+                    for c1 in si.statesdm[ccharge]:
+                        plan.add_term(cb*ndm1 + cb1, [tind(l1, b1, c1), tind(l1, c1, b),
+                                                      find(+1, c, c1, 0, l1)], None, -1)
+                    for a1 in si.statesdm[acharge]:
+                        plan.add_term(cb*ndm1 + cb1, [tind(l1, b1, a1), tind(l1, a1, b),
+                                                      find(-1, c, a1, 1, l1)], None, +1)
+            # 1st and 3rd terms
+            for c1 in si.statesdm[ccharge]:
+                c1b = si.get_ind_dm1(c1, b, bcharge)
+                for l1 in range(nleads):
+                    for b1 in si.statesdm[bcharge]:
+                        plan.add_term(cb*ndm1 + c1b, [tind(l1, c, b1), tind(l1, b1, c1),
+                                                      find(+1, b1, b, 1, l1)], None, -1)
+                    for d1 in si.statesdm[dcharge]:
+                        plan.add_term(cb*ndm1 + c1b, [tind(l1, c, d1), tind(l1, d1, c1),
+                                                      find(-1, d1, b, 0, l1)], None, +1)
+            # 5th and 4th terms
+            for d1, c1 in itertools.product(si.statesdm[dcharge], si.statesdm[ccharge]):
+                d1c1 = si.get_ind_dm1(d1, c1, ccharge)
+                for l1 in range(nleads):
+                    ind = [tind(l1, c, d1), tind(l1, c1, b)]
+                    plan.add_term(cb*ndm1 + d1c1, ind + [find(+1, c, c1, 1, l1)], None, -1)
+                    plan.add_term(cb*ndm1 + d1c1, ind + [find(-1, d1, b, 1, l1)], None, +1)
+    keys = sorted(funcs, key=funcs.get)
+    plan.func_sgn = np.array([key[0] for key in keys], dtype=longnp)
+    plan.func_b = np.array([key[1] for key in keys], dtype=longnp)
+    plan.func_a = np.array([key[2] for key in keys], dtype=longnp)
+    plan.func_hfk = np.array([key[3] for key in keys], dtype=longnp)
+    plan.diag_c, plan.diag_b = diag_c, diag_b
+    return plan
+
+
+def make_plan_iterate_2vN(si):
+    """
+    Make the plan of the terms in the iteration of the 2vN integral equation, see phi1k_iterate_2vN.
+    The operands are Tba, Tba, and the array containing fkp and fkm stacked along the first axis.
+    The factor term_fct=l*ndm1+cb labels the element Phi[1]_{l,cb}(k) to which the term contributes.
+    The term contains the values of Phi[1]_{l1,cb1} with term_src=l1*ndm1+cb1 and of its Hilbert
+    transform interpolated at the energy term_sgn*(Ek-E[term_e1]+E[term_e2]), which are complex
+    conjugated for term_sgn=+1.
+
+    Parameters
+    ----------
+    si : StateIndexingDM
+        StateIndexingDM object.
+
+    Returns
+    -------
+    AssemblyPlan
+        Plan of the terms.
+    """
+    (nleads, ndm1, nmany) = (si.nleads, si.ndm1, si.nmany)
+    plan = AssemblyPlan(ndm1, 3)
+    plan.nfct = nleads*ndm1
+    term_src, term_sgn, term_e1, term_e2 = [], [], [], []
+
+    def tind(l, b, a):
+        return (l*nmany + b)*nmany + a
+
+    def add(l, cb, ind, fm, l1, src, sgn, e1, e2):
+        plan.add_term(l*ndm1 + cb, ind + [fm*nleads + l], None, -sgn)
+        term_src.append(l1*ndm1 + src)
+        term_sgn.append(sgn)
+        term_e1.append(e1)
+        term_e2.append(e2)
+
+    for charge in range(si.ncharge-1):
+        dcharge = charge+2
+        ccharge = charge+1
+        bcharge = charge
+        acharge = charge-1
+        for c, b in itertools.product(si.statesdm[ccharge], si.statesdm[bcharge]):
+            cb = si.get_ind_dm1(c, b, bcharge)
+            for l, l1 in itertools.product(range(nleads), range(nleads)):
+                # 1st term
+                for a1 in si.statesdm[acharge]:
+                    ba1 = si.get_ind_dm1(b, a1, acharge)
+                    for b1 in si.statesdm[bcharge]:
+                        add(l, cb, [tind(l1, c, b1), tind(l, b1, a1)], 0, l1, ba1, +1, b1, b)
+                # 2nd and 5th terms
+                for b1, c1 in itertools.product(si.statesdm[bcharge], si.statesdm[ccharge]):
+                    c1b1 = si.get_ind_dm1(c1, b1, bcharge)
+                    add(l, cb, [tind(l1, c, b1), tind(l, c1, b)], 1, l1, c1b1, +1, b1, b)
+                    add(l, cb, [tind(l, c, b1), tind(l1, c1, b)], 0, l1, c1b1, +1, c, c1)
+                # 3rd term
+                for c1 in si.statesdm[ccharge]:
+                    c1b = si.get_ind_dm1(c1, b, bcharge)
+                    for d1 in si.statesdm[dcharge]:
+                        add(l, cb, [tind(l1, c, d1), tind(l, d1, c1)], 0, l1, c1b, -1, d1, b)
+                # 4th term
+                for d1, c1 in itertools.product(si.statesdm[dcharge], si.statesdm[ccharge]):
+                    d1c1 = si.get_ind_dm1(d1, c1, ccharge)
+                    add(l, cb, [tind(l1, c, d1), tind(l, c1, b)], 1, l1, d1c1, -1, d1, b)
+                # 6th term
+                for d1 in si.statesdm[dcharge]:
+                    d1c = si.get_ind_dm1(d1, c, ccharge)
+                    for c1 in si.statesdm[ccharge]:
+                        add(l, cb, [tind(l, d1, c1), tind(l1, c1, b)], 1, l1, d1c, +1, c, c1)
+                # 7th term
+                for b1, a1 in itertools.product(si.statesdm[bcharge], si.statesdm[acharge]):
+                    b1a1 = si.get_ind_dm1(b1, a1, acharge)
+                    add(l, cb, [tind(l, c, b1), tind(l1, a1, b)], 0, l1, b1a1, -1, c, a1)
+                # 8th term
+                for b1 in si.statesdm[bcharge]:
+                    cb1 = si.get_ind_dm1(c, b1, bcharge)
+                    for a1 in si.statesdm[acharge]:
+                        add(l, cb, [tind(l, b1, a1), tind(l1, a1, b)], 1, l1, cb1, -1, c, a1)
+    plan.term_src = np.array(term_src, dtype=longnp)
+    plan.term_sgn = np.array(term_sgn, dtype=longnp)
+    plan.term_e1 = np.array(term_e1, dtype=longnp)
+    plan.term_e2 = np.array(term_e2, dtype=longnp)
+    return plan
+
+
+def get_kern1_blocks(si):
+    """
+    Returns the layout of the block LU factors of the local approximation kernel L1(k).
+    The elements Phi[1]_{cb} with the state b of charge i form the block i. L1(k) couples only
+    the blocks of neighbouring charges, so it is block-tridiagonal. For each point of Ek_grid
+    the factors from lu_factor_block_tridiag are packed row-major into one row of an array.
+
+    Parameters
+    ----------
+    si : StateIndexingDM
+        StateIndexingDM object.
+
+    Returns
+    -------
+    blk_row : ndarray
+        The rows of the block i are blk_row[i]:blk_row[i+1].
+    blk_diag, blk_low, blk_up : ndarray
+        Offsets of the LU factors of the Schur complement S[i], of the block of L1(k) coupling
+        the block i to the block i-1, and of X[i] = S[i]^{-1}L1_{i,i+1} in the packed factors.
+    size : int
+        Length of the packed factors.
+    """
+    nblk = si.ncharge-1
+    n = [int(si.lenlst[i]*si.lenlst[i+1]) for i in range(nblk)]
+    blk_row = np.zeros(nblk+1, dtype=longnp)
+    blk_row[1:] = np.cumsum(n)
+    (blk_diag, blk_low, blk_up) = (np.zeros(nblk, dtype=longnp), np.zeros(nblk, dtype=longnp),
+                                   np.zeros(nblk, dtype=longnp))
+    size = 0
+    for i in range(nblk):
+        blk_diag[i] = size
+        size += n[i]*n[i]
+        blk_low[i] = size
+        size += n[i]*n[i-1] if i > 0 else 0
+        blk_up[i] = size
+        size += n[i]*n[i+1] if i < nblk-1 else 0
+    return blk_row, blk_diag, blk_low, blk_up, size
+
+
+def kern1_lu_factor_2vN(kern1, si):
+    """
+    Block LU decomposition of the local approximation kernels L1(k) for all points of Ek_grid.
+
+    Parameters
+    ----------
+    kern1 : ndarray
+        Numpy array with dimensions (len(Ek_grid), ndm1, ndm1) containing L1(k).
+    si : StateIndexingDM
+        StateIndexingDM object.
+
+    Returns
+    -------
+    kern1k_lu : tuple
+        Tuple (lu, piv) of the packed factors with dimensions (len(Ek_grid), size), see
+        get_kern1_blocks, and of the pivot indices within the blocks with dimensions
+        (len(Ek_grid), ndm1).
+    """
+    blk_row, blk_diag, blk_low, blk_up, size = get_kern1_blocks(si)
+    (nblk, npnt) = (len(blk_diag), kern1.shape[0])
+    blk = [slice(blk_row[i], blk_row[i+1]) for i in range(nblk)]
+    diag = [kern1[:, blk[i], blk[i]] for i in range(nblk)]
+    lower = [kern1[:, blk[i], blk[i-1]] if i > 0 else None for i in range(nblk)]
+    upper = [kern1[:, blk[i], blk[i+1]] if i < nblk-1 else None for i in range(nblk)]
+    lulst, pivlst, xlst = lu_factor_block_tridiag(diag, lower, upper)
+    lu = np.zeros((npnt, size), dtype=kern1.dtype)
+    piv = np.zeros((npnt, si.ndm1), dtype=longnp)
+    for i in range(nblk):
+        for off, a in [(blk_diag[i], lulst[i]), (blk_low[i], lower[i]), (blk_up[i], xlst[i])]:
+            if a is not None:
+                lu[:, off:off+a[0].size] = a.reshape(npnt, -1)
+        piv[:, blk[i]] = pivlst[i]
+    return lu, piv
+
+
+def kern1_lu_solve_2vN(kern1k_lu, b, si):
+    """
+    Solves L1(k)x = b for all points of Ek_grid using the factors from kern1_lu_factor_2vN.
+
+    Parameters
+    ----------
+    kern1k_lu : tuple
+        Factors from kern1_lu_factor_2vN.
+    b : ndarray
+        Numpy array with dimensions (len(Ek_grid), ndm1, m) containing the right hand sides.
+    si : StateIndexingDM
+        StateIndexingDM object.
+
+    Returns
+    -------
+    ndarray
+        Numpy array with dimensions (len(Ek_grid), ndm1, m) containing the solutions.
+    """
+    (lu, piv) = kern1k_lu
+    blk_row, blk_diag, blk_low, blk_up, size = get_kern1_blocks(si)
+    (nblk, npnt) = (len(blk_diag), lu.shape[0])
+    n = np.diff(blk_row)
+
+    def unpack(off, rows, cols):
+        return lu[:, off:off+rows*cols].reshape(npnt, rows, cols)
+
+    lulst = [unpack(blk_diag[i], n[i], n[i]) for i in range(nblk)]
+    pivlst = [piv[:, blk_row[i]:blk_row[i+1]] for i in range(nblk)]
+    lower = [unpack(blk_low[i], n[i], n[i-1]) if i > 0 else None for i in range(nblk)]
+    xlst = [unpack(blk_up[i], n[i], n[i+1]) if i < nblk-1 else None for i in range(nblk)]
+    sollst = lu_solve_block_tridiag(lulst, pivlst, lower, xlst,
+                                    [b[:, blk_row[i]:blk_row[i+1]] for i in range(nblk)])
+    return np.concatenate(sollst, axis=1)
+
+
+def phi1k_local_2vN_array(self):
+    """
+    Constructs Phi[1](k) corresponding to local approximation for all points of Ek_grid at once.
+    Vectorized version of phi1k_local_2vN, in which the kernels L1(k) and L0p(k) are assembled
+    for the whole grid using the plans stored in self.si.plans and L1(k)Phi[1](k) = L0p(k)Phi[0]
+    is solved by batched block LU decomposition of the block-tridiagonal L1(k).
+
+    Parameters
+    ----------
+    self : Approach2vN
+        Approach2vN object.
+
+    Returns
+    -------
+    kern0 : ndarray
+        Numpy array with dimensions (len(Ek_grid), nleads, ndm1, ndm0).
+        Gives local approximation kernel L0(k), which shows how Phi[1](k) is expressed in terms of Phi[0].
+    kern1k_lu : tuple
+        Block LU factors of local approximation kernel L1(k), see kern1_lu_factor_2vN.
+        Because L1(k) does not depend on the lead, they are the same for all leads.
+
+    The arrays kern0 and the packed factors have the storage type funcp.mtype_2vN.
+    """
+    (Ek_grid_ext, E, Tba, si, funcp) = (self.Ek_grid_ext, self.qd.Ea, self.leads.Tba, self.si, self.funcp)
+    (nleads, ndm0, ndm1) = (si.nleads, si.ndm0, si.ndm1)
+    Eklen = len(self.Ek_grid)
+    inds = np.arange(Eklen) + funcp.kpnt_left
+    Ek = Ek_grid_ext[inds]
+    plan0 = get_plan(self, make_plan_local_kern0_2vN)
+    plan1 = get_plan(self, make_plan_local_kern1_2vN)
+    # Interpolate Hilbert transforms of the Fermi functions at all shifted energies
+    hfk = np.concatenate((self.hfkp, self.hfkm))
+    Ek_shift = plan1.func_sgn*(Ek[:, None]-E[plan1.func_b]+E[plan1.func_a])
+    hfk_shift = func_2vN_array(Ek_shift, Ek_grid_ext, plan1.func_hfk, plan1.func_sgn, hfk)
+    # Note that the bias is put in the distributions and not in the dispersion
+    kern1 = plan1.get_factor_map([Tba, Tba], len(plan1.func_sgn)).dot(hfk_shift.T).T
+    kern1 = kern1.reshape(Eklen, ndm1, ndm1)
+    kern1[:, range(ndm1), range(ndm1)] += Ek[:, None]-E[plan1.diag_c]+E[plan1.diag_b]
+    fk = np.concatenate((self.fkp[:, inds], self.fkm[:, inds]))
+    kern0 = plan0.get_factor_map([Tba], 2*nleads).dot(fk).T
+    kern0 = kern0.reshape(Eklen, nleads, ndm1, ndm0).transpose(0, 2, 1, 3).reshape(Eklen, ndm1, nleads*ndm0)
+    # L1(k) is the same for all leads, so the equations for all leads are solved together
+    (lu, piv) = kern1_lu_factor_2vN(kern1, si)
+    kern0 = kern1_lu_solve_2vN((lu, piv), kern0, si)
+    kern0 = kern0.reshape(Eklen, ndm1, nleads, ndm0).transpose(0, 2, 1, 3)
+    kern0 = np.ascontiguousarray(kern0, dtype=funcp.mtype_2vN)
+    return kern0, (np.ascontiguousarray(lu, dtype=funcp.mtype_2vN), piv)
+
+
 def phi1k_iterate_2vN(ind, Ek_grid, phi1k, hphi1k, fk, kern1_inv, E, Tba, si):
     """
     Iterates the 2vN integral equation.
@@ -309,6 +707,148 @@ def phi1k_iterate_2vN(ind, Ek_grid, phi1k, hphi1k, fk, kern1_inv, E, Tba, si):
     return kern0
 
 
+def get_shift_tables_2vN(self, plan):
+    """
+    Returns the interpolation tables for the shifted energies sgn*(Ek-E[e1]+E[e2]) of the terms
+    in the plan made by make_plan_iterate_2vN. The tables depend only on the energies of the
+    quantum dot and on the grid, so they are made once per solution and cached in self.shift_tables.
+
+    Parameters
+    ----------
+    self : Approach2vN
+        Approach2vN object.
+    plan : AssemblyPlan
+        Plan made by make_plan_iterate_2vN.
+
+    self.shift_tables : tuple
+        (Modifies) Cached tables together with the energies and the grid, for which they were made.
+
+    Returns
+    -------
+    term_shift : ndarray
+        Label of the distinct shift of each term.
+    shift_idx : ndarray
+        nshifts by len(Ek_grid) array of indices a_idx into Ek_grid_ext, such that the shifted
+        energy is between Ek_grid_ext[a_idx] and Ek_grid_ext[a_idx+1].
+    shift_wa, shift_wb : ndarray
+        nshifts by len(Ek_grid) arrays of linear interpolation weights of the points a_idx and a_idx+1,
+        which are zero when the shifted energy is outside Ek_grid_ext.
+    """
+    (E, Ek_grid_ext, funcp) = (self.qd.Ea, self.Ek_grid_ext, self.funcp)
+    tables = self.shift_tables
+    if tables is not None and tables[0] is Ek_grid_ext and np.array_equal(tables[1], E):
+        return tables[2:]
+    # Distinct shifts of the energy
+    sgn_dE = np.stack((plan.term_sgn, E[plan.term_e1]-E[plan.term_e2]), axis=1)
+    shifts, term_shift = np.unique(sgn_dE, axis=0, return_inverse=True)
+    term_shift = np.ravel(term_shift)
+    Ek = Ek_grid_ext[funcp.kpnt_left:funcp.kpnt_left+len(self.Ek_grid)]
+    x = shifts[:, 0:1]*(Ek[None, :] - shifts[:, 1:2])
+    inside = np.logical_and(x >= Ek_grid_ext[0], x <= Ek_grid_ext[-1])
+    b_idx = np.clip(np.searchsorted(Ek_grid_ext, x, side='right'), 1, len(Ek_grid_ext)-1)
+    shift_idx = b_idx - 1
+    b, a = Ek_grid_ext[b_idx], Ek_grid_ext[shift_idx]
+    shift_wa = np.where(inside, (b-x)/(b-a), 0)
+    shift_wb = np.where(inside, (x-a)/(b-a), 0)
+    self.shift_tables = (Ek_grid_ext, E.copy(), term_shift, shift_idx, shift_wa, shift_wb)
+    return self.shift_tables[2:]
+
+
+def phi1k_iterate_2vN_array(self, phi1k, hphi1k, chunk_size=2**22):
+    """
+    Iterates the 2vN integral equation for all points of Ek_grid at once. The terms of
+    phi1k_iterate_2vN are taken from the plan stored in self.si.plans and the interpolation of
+    phi1k and hphi1k at the shifted energies uses the tables of get_shift_tables_2vN.
+
+    The interpolated values are gathered for all energies once for each distinct pair of the shift
+    and of the element Phi[1]_{l1,cb1}. The coefficients of the terms do not depend on the energy,
+    so the terms are summed by a sparse matrix product into slots labeled by the element
+    Phi[1]_{l,cb}(k) and by the Fermi function multiplying the term. Then the slots are multiplied
+    by the Fermi functions and the equations with the local kernel L1(k) are solved using
+    the block LU factors self.kern1k_lu.
+
+    Parameters
+    ----------
+    self : Approach2vN
+        Approach2vN object.
+    phi1k : ndarray
+        Numpy array with dimensions (len(Ek_grid_ext), nleads, ndm1, ndm0)
+        containing difference from phi1k after performing one iteration.
+    hphi1k : ndarray
+        Numpy array with dimensions (len(Ek_grid_ext), nleads, ndm1, ndm0)
+        Hilbert transform of phi1k.
+    chunk_size : int
+        Maximal number of elements in the arrays of gathered values.
+        The pairs are processed in chunks of this size.
+
+    Returns
+    -------
+    phi1k_delta : ndarray
+        Numpy array with dimensions (len(Ek_grid), nleads, ndm1, ndm0)
+        Correction to Phi[1](k) after an iteration, which has the same type as phi1k.
+    """
+    (Tba, si, funcp) = (self.leads.Tba, self.si, self.funcp)
+    (nleads, ndm1, ndm0) = (si.nleads, si.ndm1, si.ndm0)
+    plan = get_plan(self, make_plan_iterate_2vN)
+    term_shift, shift_idx, shift_wa, shift_wb = get_shift_tables_2vN(self, plan)
+    Eklen = len(self.Ek_grid)
+    nrows, nfk = nleads*ndm1, 2*nleads
+    phi1k = phi1k.reshape(phi1k.shape[0], nrows, ndm0)
+    hphi1k = hphi1k.reshape(hphi1k.shape[0], nrows, ndm0)
+    # Distinct pairs of the shift and of the element Phi[1]_{l1,cb1}
+    pairs, term_pair = np.unique(term_shift*nrows + plan.term_src, return_inverse=True)
+    pair_shift, pair_src = pairs // nrows, pairs % nrows
+    pair_conj = plan.term_sgn[np.unique(term_pair, return_index=True)[1]] == 1
+    # Distinct slots of the element Phi[1]_{l,cb} and of the Fermi function
+    slots, term_slot = np.unique(plan.term_fct*nfk + plan.term_ind[2], return_inverse=True)
+    slot_row, slot_fk = slots // nfk, slots % nfk
+    term_map = sparse.csr_matrix((pi*plan.get_term_values([Tba, Tba]), (term_slot, term_pair)),
+                                 shape=(len(slots), len(pairs)))
+    #
+    out = np.zeros((len(slots), Eklen*ndm0), dtype=complexnp)
+    chunk = max(chunk_size//(Eklen*ndm0), 1)
+    for p0 in range(0, len(pairs), chunk):
+        p = slice(p0, min(p0+chunk, len(pairs)))
+        s, src = pair_shift[p], pair_src[p][:, None]
+        idx, wa, wb = shift_idx[s], shift_wa[s][..., None], shift_wb[s][..., None]
+        u = wa*phi1k[idx, src] + wb*phi1k[idx+1, src]
+        hu = wa*hphi1k[idx, src] + wb*hphi1k[idx+1, src]
+        conj = pair_conj[p][:, None, None]
+        u = np.where(conj, np.conj(hu)-1j*np.conj(u), hu+1j*u)
+        out += term_map[:, p].dot(u.reshape(u.shape[0], -1))
+    # Multiply the slots by the Fermi functions and sum them
+    fk = np.concatenate((self.fkp, self.fkm))[:, funcp.kpnt_left:funcp.kpnt_left+Eklen]
+    out = out.reshape(len(slots), Eklen, ndm0)*fk[slot_fk][..., None]
+    slot_map = sparse.csr_matrix((np.ones(len(slots)), (slot_row, np.arange(len(slots)))),
+                                 shape=(nrows, len(slots)))
+    term = slot_map.dot(out.reshape(len(slots), -1))
+    # Solve with the local kernel L1(k), which is the same for all leads
+    term = term.reshape(nleads, ndm1, Eklen, ndm0).transpose(2, 1, 0, 3).reshape(Eklen, ndm1, nleads*ndm0)
+    phi1k_delta = kern1_lu_solve_2vN(self.kern1k_lu, term, si).reshape(Eklen, ndm1, nleads, ndm0)
+    return np.ascontiguousarray(phi1k_delta.transpose(0, 2, 1, 3), dtype=phi1k.dtype)
+
+
+def get_trapz_weights(Ek_grid):
+    """
+    Returns the weights of the trapezoidal rule on Ek_grid, which can be non-equidistant.
+
+    Parameters
+    ----------
+    Ek_grid : ndarray
+        Energy grid.
+
+    Returns
+    -------
+    ndarray
+        Weights, which multiplied by the function values on Ek_grid and summed give the integral.
+    """
+    dx = np.diff(Ek_grid)
+    weights = np.zeros(len(Ek_grid), dtype=doublenp)
+    weights[0:-1] += dx/2
+    weights[1:] += dx/2
+    return weights
+
+
 def get_phi1_phi0_2vN(self):
     """
     Integrates phi1k over energy.
@@ -328,30 +868,34 @@ def get_phi1_phi0_2vN(self):
     # (phi1k, Ek_grid, si):
     (phi1k, Ek_grid, si) = (self.phi1k, self.Ek_grid, self.si)
     # Get integrated Phi[1]_{cb} in terms of Phi[0]_{bb'}
-    phi1_phi0 = np.zeros((si.nleads, si.ndm1, si.ndm0), dtype=complexnp)
-    e_phi1_phi0 = np.zeros((si.nleads, si.ndm1, si.ndm0), dtype=complexnp)
-    Eklen = len(Ek_grid)
-    #
-    for j1 in range(Eklen):
-        # Trapezoidal rule
-        if j1 == 0:
-            dx = Ek_grid[j1+1] - Ek_grid[j1]
-        elif j1 == Eklen-1:
-            dx = Ek_grid[j1] - Ek_grid[j1-1]
-        else:
-            dx = Ek_grid[j1+1] - Ek_grid[j1-1]
-        phi1_phi0 += 1/2*dx*phi1k[j1]
-        e_phi1_phi0 += 1/2*dx*Ek_grid[j1]*phi1k[j1]
+    weights = get_trapz_weights(Ek_grid)
+    phi1_phi0 = np.tensordot(weights, phi1k, axes=1).astype(complexnp)
+    e_phi1_phi0 = np.tensordot(weights*Ek_grid, phi1k, axes=1).astype(complexnp)
     #
     self.phi1_phi0 = phi1_phi0
     self.e_phi1_phi0 = e_phi1_phi0
     return 0
 
 
+def get_dm1_block(x, si, ccharge):
+    """
+    Returns the block of the array x with the first order density matrix elements as the second
+    axis, which corresponds to Phi[1]_{cb} with the states c of charge ccharge and b of charge
+    ccharge-1. The block has the dimensions (x.shape[0], nc, nb) + x.shape[2:].
+    """
+    (nc, nb) = (si.lenlst[ccharge], si.lenlst[ccharge-1])
+    ind = si.shiftlst1[ccharge-1]
+    return x[:, ind:ind+nc*nb].reshape((x.shape[0], nc, nb) + x.shape[2:])
+
+
 def kern_phi0_2vN(self):
     """
     From Phi[1](k) generate equations containing just Phi[0].
 
+    The contributions to the rows Phi[0]_{b,bp} of the states b, bp of the same charge are
+    obtained by contracting the blocks of Tba between neighbouring charges with the blocks
+    of phi1_phi0.
+
     Parameters
     ----------
     self : Approach2vN
@@ -364,15 +908,9 @@ def kern_phi0_2vN(self):
     """
     # (phi1_phi0, E, Tba, si, funcp, mulst, tlst, dlst)
     (phi1_phi0, E, Tba, si) = (self.phi1_phi0, self.qd.Ea, self.leads.Tba, self.si)
-    # Integrated Phi[1]_{bc} in terms of phi1_phi0
-    shuffle = np.zeros((si.ndm0, si.ndm0), dtype=intnp)
-    for charge in range(si.ncharge):
-        for b, bp in itertools.combinations_with_replacement(si.statesdm[charge], 2):
-            bbp = si.get_ind_dm0(b, bp, charge)
-            bpb = si.get_ind_dm0(bp, b, charge)
-            shuffle[bbp, bpb] = 1
-            shuffle[bpb, bbp] = 1
-    phi1_phi0_conj = np.dot(np.conjugate(phi1_phi0), shuffle)
+    # Integrated Phi[1]_{bc} in terms of phi1_phi0, for which Phi[0]_{b,bp} and Phi[0]_{bp,b}
+    # are interchanged
+    phi1_phi0_conj = np.conjugate(phi1_phi0)[..., si.transpdm0]
     # Set-up normalisation row
     generate_norm_vec(self, si.ndm0)
     # Make equations for Phi[0]
@@ -380,26 +918,27 @@ def kern_phi0_2vN(self):
     self.kern = self.kern_ext[0:-1, :]
     kern = self.kern
     for charge in range(si.ncharge):
-        acharge = charge-1
-        bcharge = charge
-        ccharge = charge+1
-        for b, bp in itertools.product(si.statesdm[bcharge], si.statesdm[bcharge]):
-            bbp = si.get_ind_dm0(b, bp, bcharge)
-            kern[bbp, bbp] = E[b]-E[bp]
-            #
-            for a1 in si.statesdm[acharge]:
-                bpa1 = si.get_ind_dm1(bp, a1, acharge)
-                ba1 = si.get_ind_dm1(b, a1, acharge)
-                for l in range(si.nleads):
-                    kern[bbp] += +Tba[l, b, a1]*phi1_phi0_conj[l, bpa1]
-                    kern[bbp] += -phi1_phi0[l, ba1]*Tba[l, a1, bp]
-            #
-            for c1 in si.statesdm[ccharge]:
-                c1bp = si.get_ind_dm1(c1, bp, bcharge)
-                c1b = si.get_ind_dm1(c1, b, bcharge)
-                for l in range(si.nleads):
-                    kern[bbp] += +Tba[l, b, c1]*phi1_phi0[l, c1bp]
-                    kern[bbp] += -phi1_phi0_conj[l, c1b]*Tba[l, c1, bp]
+        (states_a, states_b, states_c) = (si.statesdm[charge-1], si.statesdm[charge], si.statesdm[charge+1])
+        nb = len(states_b)
+        if nb == 0:
+            continue
+        bbp = si.mapdm0[si.shiftlst0[charge] + np.arange(nb*nb)]
+        # kern_bbp has the dimensions (b, bp, ndm0)
+        kern_bbp = np.zeros((nb, nb, si.ndm0), dtype=complexnp)
+        if charge > 0 and len(states_a) > 0:
+            (Tba_ba, Tba_ab) = (Tba[:, states_b][:, :, states_a], Tba[:, states_a][:, :, states_b])
+            kern_bbp += np.tensordot(Tba_ba, get_dm1_block(phi1_phi0_conj, si, charge), axes=([0, 2], [0, 2]))
+            kern_bbp -= np.tensordot(get_dm1_block(phi1_phi0, si, charge), Tba_ab,
+                                     axes=([0, 2], [0, 1])).transpose(0, 2, 1)
+        if len(states_c) > 0:
+            (Tba_bc, Tba_cb) = (Tba[:, states_b][:, :, states_c], Tba[:, states_c][:, :, states_b])
+            kern_bbp += np.tensordot(Tba_bc, get_dm1_block(phi1_phi0, si, charge+1), axes=([0, 2], [0, 1]))
+            kern_bbp -= np.tensordot(get_dm1_block(phi1_phi0_conj, si, charge+1), Tba_cb,
+                                     axes=([0, 1], [0, 1])).transpose(0, 2, 1)
+        kern_bbp = kern_bbp.reshape(nb*nb, si.ndm0)
+        valid = bbp >= 0
+        kern[bbp[valid]] += kern_bbp[valid]
+        kern[bbp[valid], bbp[valid]] += (E[states_b][:, None]-E[states_b][None, :]).ravel()[valid]
     return 0
 
 
@@ -427,22 +966,17 @@ def generate_current_2vN(self):
     (phi1_phi0, e_phi1_phi0) = (self.phi1_phi0, self.e_phi1_phi0)
     (phi0, Tba, si) = (self.phi0, self.leads.Tba, self.si)
     #
-    phi1 = np.zeros((si.nleads, si.ndm1), dtype=complexnp)
-    h_phi1 = np.zeros((si.nleads, si.ndm1), dtype=complexnp)
-    for l in range(si.nleads):
-        phi1[l] = np.dot(phi1_phi0[l], phi0)
-        h_phi1[l] = np.dot(e_phi1_phi0[l], phi0)
+    phi1 = np.dot(phi1_phi0, phi0)
+    h_phi1 = np.dot(e_phi1_phi0, phi0)
     #
     current = np.zeros(si.nleads, dtype=complexnp)
     energy_current = np.zeros(si.nleads, dtype=complexnp)
     for charge in range(si.ncharge-1):
-        ccharge = charge+1
-        bcharge = charge
-        for c, b in itertools.product(si.statesdm[ccharge], si.statesdm[bcharge]):
-            cb = si.get_ind_dm1(c, b, bcharge)
-            for l in range(si.nleads):
-                current[l] += phi1[l, cb]*Tba[l, b, c]
-                energy_current[l] = energy_current[l] + h_phi1[l, cb]*Tba[l, b, c]
+        (states_c, states_b) = (si.statesdm[charge+1], si.statesdm[charge])
+        # Tba_bc.transpose(0, 2, 1) has the dimensions (nleads, c, b) of the block of Phi[1]_{cb}
+        Tba_bc = Tba[:, states_b][:, :, states_c]
+        current += np.sum(get_dm1_block(phi1, si, charge+1)*Tba_bc.transpose(0, 2, 1), axis=(1, 2))
+        energy_current += np.sum(get_dm1_block(h_phi1, si, charge+1)*Tba_bc.transpose(0, 2, 1), axis=(1, 2))
     self.phi1 = phi1
     self.current = np.array(-2*current.imag, dtype=doublenp)
     self.energy_current = np.array(-2*energy_current.imag, dtype=doublenp)
@@ -491,7 +1025,8 @@ def get_grid_ext(self):
         Approach2vN object.
 
     self.Ek_grid_ext : ndarray
-        (Modifies) Extended Ek_grid from emin to emax.
+        (Modifies) Extended Ek_grid from emin to emax. It is kept, if it covers this range
+        and contains the same Ek_grid.
     self.funcp.kpnt_left : int
         (Modifies) Number of points Ek_grid is extended to the left.
     self.funcp.kpnt_right : int
@@ -501,17 +1036,38 @@ def get_grid_ext(self):
                                            self.funcp.dmin, self.funcp.dmax,
                                            self.funcp.ext_fct)
     Ek_grid = self.Ek_grid
-    step = Ek_grid[1]-Ek_grid[0]
+    # For a non-equidistant grid the steps at the edges are used
+    step_left, step_right = Ek_grid[1]-Ek_grid[0], Ek_grid[-1]-Ek_grid[-2]
     emin = ext_fct*(emin_-dmin)+dmin
     emax = ext_fct*(emax_-dmax)+dmax
-    ext_left = np.sort(-np.arange(-dmin+step, -emin+step, step))
-    ext_right = np.arange(dmax+step, emax+step, step)
+    # The previous extended grid is kept if it covers the range from emin to emax,
+    # so the cached Fermi functions in funcp.fk_tables can be reused
+    (Ek_grid_ext, kpnt_left) = (self.Ek_grid_ext, self.funcp.kpnt_left)
+    if (len(Ek_grid_ext) == kpnt_left+len(Ek_grid)+self.funcp.kpnt_right
+            and np.array_equal(Ek_grid_ext[kpnt_left:kpnt_left+len(Ek_grid)], Ek_grid)
+            and Ek_grid_ext[0]-step_left < emin and emax < Ek_grid_ext[-1]+step_right):
+        return 0
+    ext_left = np.sort(-np.arange(-dmin+step_left, -emin+step_left, step_left))
+    ext_right = np.arange(dmax+step_right, emax+step_right, step_right)
     self.Ek_grid_ext = np.concatenate((ext_left, Ek_grid, ext_right))
     self.funcp.kpnt_left, self.funcp.kpnt_right = len(ext_left), len(ext_right)
     return 0
 
 
-def get_htransf_phi1k(phi1k, funcp):
+def get_grid_htransf(self):
+    """
+    Returns the extended grid Ek_grid_ext, if it is non-equidistant, and None otherwise.
+    It is passed to get_htransf_phi1k and get_htransf_fk.
+
+    Parameters
+    ----------
+    self : Approach2vN
+        Approach2vN object.
+    """
+    return None if self.funcp.grid_2vN == 'uniform' else self.Ek_grid_ext
+
+
+def get_htransf_phi1k(phi1k, funcp, hphi1k=None, grid=None):
     """
     Performs Hilbert transform of phi1k.
 
@@ -522,9 +1078,14 @@ def get_htransf_phi1k(phi1k, funcp):
         containing energy resolved first order density matrix elements Phi[1](k).
     funcp : FunctionProperties
         FunctionProperties object.
+    hphi1k : ndarray
+        (Modifies) If given and having the right shape, the Hilbert transform is written into this array.
+    grid : ndarray
+        Non-equidistant extended grid Ek_grid_ext. By default the grid is equidistant.
 
-    funcp.ht_ker : ndarray
-        (Modifies) Kernel used when performing Hilbert transform using FFT.
+    funcp.htransf : HilbertTransform
+        (Modifies) Object performing Hilbert transform using FFT, which caches the kernels.
+        The FFT uses funcp.nthreads workers.
 
     Returns
     -------
@@ -538,23 +1099,18 @@ def get_htransf_phi1k(phi1k, funcp):
     """
     nleads, ndm1, ndm0 = phi1k.shape[1], phi1k.shape[2], phi1k.shape[3]
     Eklen_ext = phi1k.shape[0] + funcp.kpnt_left + funcp.kpnt_right
-    # Create the kernels for Hilbert transformation
-    if funcp.ht_ker is None or 2*Eklen_ext != len(funcp.ht_ker):
-        funcp.ht_ker = kernel_fredriksen(Eklen_ext)
     # Make phi1k on extended grid Ek_grid_ext
     # Pad phi1k values with zeros from the left and the right
-    phi1k = np.concatenate((np.zeros((funcp.kpnt_left, nleads, ndm1, ndm0)),
-                            phi1k,
-                            np.zeros((funcp.kpnt_right, nleads, ndm1, ndm0))), axis=0)
-    # Make the Hilbert transformation
-    hphi1k = np.zeros(phi1k.shape, dtype=complexnp)
-    for l, cb, bbp in itertools.product(range(nleads), range(ndm1), range(ndm0)):
-        # print(l, cb, bbp)
-        hphi1k[:, l, cb, bbp] = hilbert_fredriksen(phi1k[:, l, cb, bbp], funcp.ht_ker)
-    return phi1k, hphi1k
+    phi1k_ext = np.zeros((Eklen_ext, nleads, ndm1, ndm0), dtype=phi1k.dtype)
+    phi1k_ext[funcp.kpnt_left:funcp.kpnt_left+phi1k.shape[0]] = phi1k
+    # Make the Hilbert transformation of all elements at once
+    if hphi1k is None or hphi1k.shape != phi1k_ext.shape or hphi1k.dtype != phi1k_ext.dtype:
+        hphi1k = np.zeros(phi1k_ext.shape, dtype=phi1k_ext.dtype)
+    funcp.htransf(phi1k_ext, out=hphi1k, grid=grid, workers=max(funcp.nthreads, 1))
+    return phi1k_ext, hphi1k
 
 
-def get_htransf_fk(fk, funcp):
+def get_htransf_fk(fk, funcp, grid=None):
     """
     Performs Hilbert transform of Fermi function.
     The energy is shifted by positive infinitesimal
@@ -567,9 +1123,12 @@ def get_htransf_fk(fk, funcp):
         containing Fermi function values on the grid Ek_grid.
     funcp : FunctionProperties
         FunctionProperties object.
+    grid : ndarray
+        Non-equidistant extended grid Ek_grid_ext. By default the grid is equidistant.
 
-    funcp.ht_ker : ndarray
-        (Modifies) Kernel used when performing Hilbert transform using FFT.
+    funcp.htransf : HilbertTransform
+        (Modifies) Object performing Hilbert transform using FFT, which caches the kernels.
+        The FFT uses funcp.nthreads workers.
 
     Returns
     -------
@@ -581,23 +1140,63 @@ def get_htransf_fk(fk, funcp):
         Hilbert transform of fk on extended grid.
     """
     nleads = fk.shape[0]
-    Eklen_ext = fk.shape[1] + funcp.kpnt_left + funcp.kpnt_right
-    # Create the kernels for Hilbert transformation
-    if funcp.ht_ker is None or 2*Eklen_ext != len(funcp.ht_ker):
-        funcp.ht_ker = kernel_fredriksen(Eklen_ext)
     # Pad fk values with zeros from the left and the right
     fk = np.concatenate((np.zeros((nleads, funcp.kpnt_left)),
                          fk,
                          np.zeros((nleads, funcp.kpnt_right))), axis=1)
     # Calculate the Hilbert transform with added positive infinitesimal of the Fermi functions
-    hfk = np.zeros((nleads, Eklen_ext), dtype=doublenp)
-    for l in range(nleads):
-        hfk[l] = hilbert_fredriksen(fk[l], funcp.ht_ker).real
+    # using real FFT of all leads at once
+    hfk = np.ascontiguousarray(funcp.htransf(fk.T, grid=grid, workers=max(funcp.nthreads, 1)).T)
     # The energy is shifted by positive infinitesimal to the complex upper half-plane
     hfk = hfk - 1j*fk
     return fk, hfk
 
 
+def get_fk_2vN(self):
+    """
+    Generates the Fermi functions and their Hilbert transforms on the extended grid Ek_grid_ext.
+    They depend only on Ek_grid_ext, mulst, and tlst, so they are cached in funcp.fk_tables and
+    reused, for example, in sweeps of the gate voltage or of the tunneling amplitudes.
+    The least recently used arrays are removed when the cache is full.
+
+    Parameters
+    ----------
+    self : Approach2vN
+        Approach2vN object.
+
+    self.fkp : ndarray
+        (Modifies) nleads by len(Ek_grid_ext) numpy array containing Fermi function.
+    self.fkm : ndarray
+        (Modifies) nleads by len(Ek_grid_ext) numpy array containing 1-Fermi function.
+    self.hfkp : ndarray
+        (Modifies) Hilbert transform of fkp.
+    self.hfkm : ndarray
+        (Modifies) Hilbert transform of fkm.
+    self.funcp.fk_tables : dict
+        (Modifies) Cache of (fkp, fkm, hfkp, hfkm).
+    """
+    (Ek_grid, funcp, si) = (self.Ek_grid, self.funcp, self.si)
+    (mulst, tlst) = (self.leads.mulst, self.leads.tlst)
+    key = (self.Ek_grid_ext.tobytes(), funcp.kpnt_left, funcp.grid_2vN,
+           tuple(np.ravel(mulst).tolist()), tuple(np.ravel(tlst).tolist()))
+    tables = funcp.fk_tables
+    fk = tables.pop(key, None)
+    if fk is None:
+        if len(tables) >= funcp.fk_tables_size:
+            tables.pop(next(iter(tables)))
+        fkp = np.zeros((si.nleads, len(Ek_grid)), dtype=doublenp)
+        for l in range(si.nleads):
+            fkp[l] = 1/(np.exp((Ek_grid - mulst[l])/tlst[l]) + 1)
+        fkm = 1-fkp
+        fkp, hfkp = get_htransf_fk(fkp, funcp, get_grid_htransf(self))
+        fkm, hfkm = get_htransf_fk(fkm, funcp, get_grid_htransf(self))
+        fk = (fkp, fkm, hfkp, hfkm)
+    # The used arrays are moved to the end of the cache
+    tables[key] = fk
+    (self.fkp, self.fkm, self.hfkp, self.hfkm) = fk
+    return 0
+
+
 def iterate_2vN(self):
     """
     Performs the iterative solution of the 2vN approach integral equations.
@@ -613,9 +1212,9 @@ def iterate_2vN(self):
     self.hphi1k_delta : ndarray
         (Modifies) Numpy array with dimensions (len(Ek_grid_ext), nleads, ndm1, ndm0).
         Hilbert transform of phi1k_delta on extended grid Ek_grid_ext.
-    self.kern1k_inv : ndarray
-        (Modifies) Numpy array with dimensions (len(Ek_grid), nleads, ndm1, ndm1)
-        corresponding to inverse of energy resolved local kernel for Phi[1](k).
+    self.kern1k_lu : tuple
+        (Modifies) Block LU factors of energy resolved local kernel for Phi[1](k),
+        see kern1_lu_factor_2vN.
     self.funcp.emin : float
         (Modifies) Minimal energy in the updated Ek_grid.
     self.funcp.emax : float
@@ -635,53 +1234,36 @@ def iterate_2vN(self):
     self.hfkm : ndarray
         (Modifies) Hilbert transform of fkm.
     """
-    (Ek_grid, Ek_grid_ext) = (self.Ek_grid, self.Ek_grid_ext)
-    (E, Tba, si, funcp) = (self.qd.Ea, self.leads.Tba, self.si, self.funcp)
-    (mulst, tlst) = (self.leads.mulst, self.leads.tlst)
+    funcp = self.funcp
     # Assign self.phi1k_delta to phi1k_delta_old, because the new phi1k_delta
     # will be generated in this function
-    (phi1k_delta_old, kern1k_inv) = (self.phi1k_delta, self.kern1k_inv)
+    (phi1k_delta_old, kern1k_lu) = (self.phi1k_delta, self.kern1k_lu)
     #
-    Eklen = len(Ek_grid)
     if phi1k_delta_old is None:
         # Define the extended grid Ek_grid_ext for calculations outside the bandwidth
         # Here self.funcp.emin, self.funcp.emax are defined
         get_emin_emax(self)
         # Here self.Ek_grid_ext, self.funcp.kpnt_left, self.funcp.kpnt_right are defined
         get_grid_ext(self)
-        Ek_grid_ext = self.Ek_grid_ext
         # Generate the Fermi functions on the grid
-        # This is necessary to generate only if Ek_grid, mulst, or tlst are changed
-        self.fkp = np.zeros((si.nleads, Eklen), dtype=doublenp)
-        for l in range(si.nleads):
-            self.fkp[l] = 1/(np.exp((Ek_grid - mulst[l])/tlst[l]) + 1)
-        self.fkm = 1-self.fkp
-        self.fkp, self.hfkp = get_htransf_fk(self.fkp, funcp)
-        self.fkm, self.hfkm = get_htransf_fk(self.fkm, funcp)
+        # They are generated only if Ek_grid_ext, mulst, or tlst are changed
+        get_fk_2vN(self)
         # Calculate the zeroth iteration of Phi[1](k)
-        phi1k_delta = np.zeros((Eklen, si.nleads, si.ndm1, si.ndm0), dtype=complexnp)
-        kern1k_inv = np.zeros((Eklen, si.nleads, si.ndm1, si.ndm1), dtype=complexnp)
-        for j1 in range(Eklen):
-            ind = j1 + funcp.kpnt_left
-            phi1k_delta[j1], kern1k_inv[j1] = phi1k_local_2vN(ind, Ek_grid_ext, self.fkp,
-                                                              self.hfkp, self.hfkm, E, Tba, si)
+        phi1k_delta, kern1k_lu = phi1k_local_2vN_array(self)
         hphi1k_delta = None
-    elif kern1k_inv is None:
+    elif kern1k_lu is None:
         phi1k_delta, hphi1k_delta = None, None
     else:
         # Hilbert transform phi1k_delta_old on extended grid Ek_grid_ext
         # print('Hilbert transforming')
-        phi1k_delta_old, hphi1k_delta = get_htransf_phi1k(phi1k_delta_old, funcp)
+        phi1k_delta_old, hphi1k_delta = get_htransf_phi1k(phi1k_delta_old, funcp, self.hphi1k_delta,
+                                                          get_grid_htransf(self))
         # print('Making an iteration')
-        phi1k_delta = np.zeros((Eklen, si.nleads, si.ndm1, si.ndm0), dtype=complexnp)
-        for j1 in range(Eklen):
-            ind = j1 + funcp.kpnt_left
-            phi1k_delta[j1] = phi1k_iterate_2vN(ind, Ek_grid_ext, phi1k_delta_old, hphi1k_delta,
-                                                self.fkp, kern1k_inv[j1], E, Tba, si)
+        phi1k_delta = phi1k_iterate_2vN_array(self, phi1k_delta_old, hphi1k_delta)
     #
     self.phi1k_delta = phi1k_delta
     self.hphi1k_delta = hphi1k_delta
-    self.kern1k_inv = kern1k_inv
+    self.kern1k_lu = kern1k_lu
     return 0
 
 
@@ -4,12 +4,15 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import numpy as np
-import itertools
 
 from ...mytypes import doublenp
+from ...mytypes import longnp
 
-from ...specfunc.specfunc import func_pauli
+from ...specfunc.specfunc import func_pauli_array
 from ...aprclass import Approach
+from .kernel_handler import KernelHandler
+from .assembly_plan import AssemblyPlan
+from .assembly_plan import get_plan
 
 
 def generate_norm_vec(self, length):
@@ -48,62 +51,106 @@ def generate_norm_vec(self, length):
     return 0
 
 
-def generate_paulifct(self):
+def make_paulifct(self, mulst, tlst, dlst):
     """
-    Make factors used for generating Pauli master equation kernel.
+    Make factors used for generating Pauli master equation kernel
+    for given lead parameters.
 
     Parameters
     ----------
     self : Approach
         Approach object.
+    mulst, tlst : array
+        Chemical potentials and temperatures of the leads given as (..., nleads) arrays.
+    dlst : array
+        Bandwidths of the leads given as (..., nleads, 2) array.
 
-    self.paulifct : array
-        (Modifies) Factors used for generating Pauli master equation kernel.
+    Returns
+    -------
+    array
+        (..., nleads, ndm1, 2) array of factors used for generating Pauli master equation kernel.
     """
-    (E, Tba, si, mulst, tlst, dlst) = (self.qd.Ea, self.leads.Tba, self.si,
-                                       self.leads.mulst, self.leads.tlst, self.leads.dlst)
+    (E, Tba, si) = (self.qd.Ea, self.leads.Tba, self.si)
     itype = self.funcp.itype
-    paulifct = np.zeros((si.nleads, si.ndm1, 2), dtype=doublenp)
+    shape = np.shape(mulst)[:-1]
+    paulifct = np.zeros(shape+(si.nleads, si.ndm1, 2), dtype=doublenp)
     for charge in range(si.ncharge-1):
         ccharge = charge+1
         bcharge = charge
-        for c, b in itertools.product(si.statesdm[ccharge], si.statesdm[bcharge]):
-            cb = si.get_ind_dm1(c, b, bcharge)
-            Ecb = E[c]-E[b]
-            for l in range(si.nleads):
-                xcb = (Tba[l, b, c]*Tba[l, c, b]).real
-                rez = func_pauli(Ecb, mulst[l], tlst[l], dlst[l, 0], dlst[l, 1], itype)
-                paulifct[l, cb, 0] = xcb*rez[0]
-                paulifct[l, cb, 1] = xcb*rez[1]
-    self.paulifct = paulifct
+        statesc, statesb = si.statesdm[ccharge], si.statesdm[bcharge]
+        if len(statesc) == 0 or len(statesb) == 0:
+            continue
+        # All the elements cb of the charge pair are stored contiguously with b changing fastest
+        ind = si.get_ind_dm1(statesc[0], statesb[0], bcharge)
+        cb = slice(ind, ind+len(statesc)*len(statesb))
+        Ecb = np.subtract.outer(E[statesc], E[statesb]).ravel()
+        Tbc = Tba[:, statesb, :][:, :, statesc]
+        Tcb = Tba[:, statesc, :][:, :, statesb]
+        xcb = (Tbc.transpose(0, 2, 1)*Tcb).real.reshape(si.nleads, -1)
+        rez = func_pauli_array(Ecb, np.ravel(mulst), np.ravel(tlst),
+                               np.ravel(dlst[..., 0]), np.ravel(dlst[..., 1]), itype)
+        paulifct[..., cb, :] = xcb[:, :, np.newaxis]*rez.reshape(shape+(si.nleads, len(Ecb), 2))
+    return paulifct
+
+
+def generate_paulifct(self):
+    """
+    Make factors used for generating Pauli master equation kernel.
+
+    Parameters
+    ----------
+    self : Approach
+        Approach object.
+
+    self.paulifct : array
+        (Modifies) Factors used for generating Pauli master equation kernel.
+    """
+    self.paulifct = make_paulifct(self, self.leads.mulst, self.leads.tlst, self.leads.dlst)
+    return 0
+
+
+def generate_paulifct_batch(self, mulst, tlst, dlst):
+    """
+    Make factors used for generating Pauli master equation kernels for a batch of lead parameters.
+
+    Parameters
+    ----------
+    self : Approach
+        Approach object.
+    mulst, tlst : array
+        npoints by nleads arrays of chemical potentials and temperatures.
+    dlst : array
+        npoints by nleads by 2 array of bandwidths.
+
+    self.paulifct_batch : array
+        (Modifies) npoints by nleads by ndm1 by 2 array of factors.
+    """
+    self.paulifct_batch = make_paulifct(self, mulst, tlst, dlst)
     return 0
 
 
 # ---------------------------------------------------------------------------------------------------
 # Pauli master equation
 # ---------------------------------------------------------------------------------------------------
-def generate_kern_pauli(self):
+def make_plan_pauli(si):
     """
-    Generate Pauli master equation kernel.
+    Make the assembly plan of Pauli master equation kernel. The operand is paulifct.
 
     Parameters
     ----------
-    self : Approach
-        Approach object.
+    si : StateIndexingDM
+        StateIndexingDM object.
 
-    self.kern : array
-        (Modifies) Kernel matrix for Pauli master equation.
-    self.bvec : array
-        (Modifies) Right hand side column vector for master equation.
-        The entry funcp.norm_row is 1 representing normalization condition.
+    Returns
+    -------
+    AssemblyPlan
+        Assembly plan of the kernel.
     """
-    (paulifct, si) = (self.paulifct, self.si)
+    plan = AssemblyPlan(si.npauli, 1)
 
-    self.kern_ext = np.zeros((si.npauli+1, si.npauli), dtype=doublenp)
-    self.kern = self.kern_ext[0:-1, :]
+    def ind(l, cb, i):
+        return (l*si.ndm1 + cb)*2 + i
 
-    generate_norm_vec(self, si.npauli)
-    kern = self.kern
     for charge in range(si.ncharge):
         for b in si.statesdm[charge]:
             bb = si.get_ind_dm0(b, b, charge)
@@ -112,15 +159,129 @@ def generate_kern_pauli(self):
                 for a in si.statesdm[charge-1]:
                     aa = si.get_ind_dm0(a, a, charge-1)
                     ba = si.get_ind_dm1(b, a, charge-1)
+                    fct_bb, fct_aa = plan.new_fct(), plan.new_fct()
                     for l in range(si.nleads):
-                        kern[bb, bb] -= paulifct[l, ba, 1]
-                        kern[bb, aa] += paulifct[l, ba, 0]
+                        plan.add_term(fct_bb, [ind(l, ba, 1)])
+                        plan.add_term(fct_aa, [ind(l, ba, 0)])
+                    plan.add_entry(bb, bb, fct_bb, re=-1)
+                    plan.add_entry(bb, aa, fct_aa, re=1)
                 for c in si.statesdm[charge+1]:
                     cc = si.get_ind_dm0(c, c, charge+1)
                     cb = si.get_ind_dm1(c, b, charge)
+                    fct_bb, fct_cc = plan.new_fct(), plan.new_fct()
                     for l in range(si.nleads):
-                        kern[bb, bb] -= paulifct[l, cb, 0]
-                        kern[bb, cc] += paulifct[l, cb, 1]
+                        plan.add_term(fct_bb, [ind(l, cb, 0)])
+                        plan.add_term(fct_cc, [ind(l, cb, 1)])
+                    plan.add_entry(bb, bb, fct_bb, re=-1)
+                    plan.add_entry(bb, cc, fct_cc, re=1)
+    return plan
+
+
+def generate_kern_pauli(self):
+    """
+    Generate Pauli master equation kernel using the assembly plan stored in self.si.plans.
+
+    Parameters
+    ----------
+    self : Approach
+        Approach object.
+
+    self.kern : array
+        (Modifies) Kernel matrix for Pauli master equation.
+    self.bvec : array
+        (Modifies) Right hand side column vector for master equation.
+        The entry funcp.norm_row is 1 representing normalization condition.
+    """
+    (paulifct, si) = (self.paulifct, self.si)
+
+    kh = KernelHandler(self, si.npauli)
+
+    generate_norm_vec(self, si.npauli)
+    get_plan(self, make_plan_pauli).assemble(kh, [paulifct])
+    kh.finalize()
+    return 0
+
+
+def generate_kern_pauli_batch(self):
+    """
+    Generate a stack of Pauli master equation kernels for a batch of lead parameters.
+
+    Parameters
+    ----------
+    self : Approach
+        Approach object.
+
+    self.kern_batch : array
+        (Modifies) npoints by npauli by npauli array of kernels.
+    self.norm_vec : array
+        (Modifies) Left hand side of the normalisation condition.
+    """
+    si = self.si
+    generate_norm_vec(self, si.npauli)
+    plan = get_plan(self, make_plan_pauli)
+    self.kern_batch = plan.assemble_batch([self.paulifct_batch], [True])
+    return 0
+
+
+def generate_kern_pauli_block(self):
+    """
+    Generate Pauli master equation kernel in block-tridiagonal form.
+
+    The Pauli kernel only couples the states, which differ in charge by one.
+    So when the states are grouped by charge, the kernel is block-tridiagonal
+    and the blocks can be generated without forming the full kernel matrix.
+
+    Parameters
+    ----------
+    self : Approach
+        Approach object.
+
+    self.kern_blocks : tuple
+        (Modifies) Tuple (diag, lower, upper) of lists containing diagonal blocks,
+        blocks coupling charge to charge-1, and blocks coupling charge to charge+1.
+        Only the charge states containing some many-body states are included.
+    self.norm_vec : array
+        (Modifies) Left hand side of the normalisation condition.
+    """
+    (paulifct, si) = (self.paulifct, self.si)
+    generate_norm_vec(self, si.npauli)
+    paulifct_sum = paulifct.sum(axis=0)
+
+    # Local Pauli indices and row flags of the states in each charge sector
+    mapping, rows, npauli_charge = [], [], []
+    for charge in range(si.ncharge):
+        nb = len(si.statesdm[charge])
+        ind = si.shiftlst0[charge] + np.arange(nb)*(si.lenlst[charge]+1)
+        mapping.append(si.mapdm0[ind])
+        rows.append(si.booldm0[ind].astype(bool))
+        npauli_charge.append(int(np.sum(si.booldm0[ind])))
+        if nb > 0:
+            mapping[-1] = mapping[-1] - np.min(mapping[-1])
+
+    charges = [charge for charge in range(si.ncharge) if npauli_charge[charge] > 0]
+    nsec = [npauli_charge[charge] for charge in charges] + [0]
+    diag = [np.zeros((nsec[k], nsec[k]), dtype=doublenp) for k in range(len(charges))]
+    lower = [np.zeros((nsec[k], nsec[k-1]), dtype=doublenp) for k in range(len(charges))]
+    upper = [np.zeros((nsec[k], nsec[k+1]), dtype=doublenp) for k in range(len(charges))]
+
+    for k in range(len(charges)-1):
+        bcharge, ccharge = charges[k], charges[k+1]
+        if ccharge != bcharge+1:
+            continue
+        nb, nc = len(si.statesdm[bcharge]), len(si.statesdm[ccharge])
+        cb = si.shiftlst1[bcharge]
+        # fct0[c, b] is the rate from b to c, fct1[c, b] is the rate from c to b
+        fct0 = paulifct_sum[cb:cb+nc*nb, 0].reshape(nc, nb)
+        fct1 = paulifct_sum[cb:cb+nc*nb, 1].reshape(nc, nb)
+        map_b, map_c = mapping[bcharge], mapping[ccharge]
+        row_b, row_c = rows[bcharge], rows[ccharge]
+        #
+        np.add.at(diag[k], (map_b[row_b], map_b[row_b]), -fct0.sum(axis=0)[row_b])
+        np.add.at(upper[k], (map_b[row_b][:, None], map_c[None, :]), fct1.T[row_b])
+        np.add.at(diag[k+1], (map_c[row_c], map_c[row_c]), -fct1.sum(axis=1)[row_c])
+        np.add.at(lower[k+1], (map_c[row_c][:, None], map_b[None, :]), fct0[row_c])
+
+    self.kern_blocks = (diag, lower, upper)
     return 0
 
 
@@ -162,6 +323,44 @@ def generate_current_pauli(self):
     return 0
 
 
+def generate_current_pauli_batch(self):
+    """
+    Calculates currents using Pauli master equation approach for a batch of lead parameters.
+
+    Parameters
+    ----------
+    self : Approach
+        Approach object.
+
+    self.current_batch : array
+        (Modifies) npoints by nleads array of currents.
+    self.energy_current_batch : array
+        (Modifies) npoints by nleads array of energy currents.
+    self.heat_current_batch : array
+        (Modifies) npoints by nleads array of heat currents.
+    """
+    (phi0, E, paulifct, si) = (self.phi0_batch, self.qd.Ea, self.paulifct_batch, self.si)
+    # Indices of the diagonal elements bb, cc and energies Ecb for each element cb
+    bb = np.zeros(si.ndm1, dtype=longnp)
+    cc = np.zeros(si.ndm1, dtype=longnp)
+    Ecb = np.zeros(si.ndm1, dtype=doublenp)
+    for charge in range(si.ncharge-1):
+        ccharge = charge+1
+        bcharge = charge
+        for c in si.statesdm[ccharge]:
+            for b in si.statesdm[bcharge]:
+                cb = si.get_ind_dm1(c, b, bcharge)
+                bb[cb] = si.get_ind_dm0(b, b, bcharge)
+                cc[cb] = si.get_ind_dm0(c, c, ccharge)
+                Ecb[cb] = E[c]-E[b]
+    fct = (+ phi0[:, np.newaxis, bb]*paulifct[..., 0]
+           - phi0[:, np.newaxis, cc]*paulifct[..., 1])
+    self.current_batch = fct.sum(axis=2)
+    self.energy_current_batch = np.dot(fct, Ecb)
+    self.heat_current_batch = self.energy_current_batch - self.current_batch*self.mulst_batch
+    return 0
+
+
 def generate_vec_pauli(phi0, self):
     """
     Acts on given phi0 with Liouvillian of Pauli approach.
@@ -209,6 +408,10 @@ class ApproachPyPauli(Approach):
     kerntype = 'pyPauli'
     generate_fct = staticmethod(generate_paulifct)
     generate_kern = staticmethod(generate_kern_pauli)
+    generate_kern_block = staticmethod(generate_kern_pauli_block)
+    generate_fct_batch = staticmethod(generate_paulifct_batch)
+    generate_kern_batch = staticmethod(generate_kern_pauli_batch)
+    generate_current_batch = staticmethod(generate_current_pauli_batch)
     generate_current = staticmethod(generate_current_pauli)
     generate_vec = staticmethod(generate_vec_pauli)
 # ---------------------------------------------------------------------------------------------------
@@ -11,6 +11,10 @@ from ...mytypes import doublenp
 from ...mytypes import complexnp
 
 from ...aprclass import Approach
+from .kernel_handler import KernelHandler
+from .assembly_plan import AssemblyPlan
+from .assembly_plan import add_dm0_entries
+from .assembly_plan import get_plan
 from .neumann1 import generate_phi1fct
 from .pauli import generate_norm_vec
 
@@ -18,15 +22,16 @@ from .pauli import generate_norm_vec
 # ---------------------------------------------------------------------------------------------------
 # Redfield approach
 # ---------------------------------------------------------------------------------------------------
-def generate_kern_redfield(self):
-    (E, Tba, phi1fct, si) = (self.qd.Ea, self.leads.Tba, self.phi1fct, self.si)
-    npauli, ndm0, nleads = si.npauli, si.ndm0, si.nleads
+def make_plan_redfield(si):
+    plan = AssemblyPlan(si.ndm0r, 3)
+    npauli, ndm0, nleads, nmany = si.npauli, si.ndm0, si.nleads, si.nmany
 
-    self.kern_ext = np.zeros((si.ndm0r+1, si.ndm0r), dtype=doublenp)
-    self.kern = self.kern_ext[0:-1, :]
+    def tind(l, b, a):
+        return (l*nmany + b)*nmany + a
+
+    def find(l, cb, i):
+        return (l*si.ndm1 + cb)*2 + i
 
-    generate_norm_vec(self, si.ndm0r)
-    kern = self.kern
     for charge in range(si.ncharge):
         acharge = charge-1
         bcharge = charge
@@ -38,90 +43,85 @@ def generate_kern_redfield(self):
                 bbpi = ndm0 + bbp - npauli
                 bbpi_bool = True if bbpi >= ndm0 else False
                 if bbpi_bool:
-                    kern[bbp, bbpi] += E[b]-E[bp]
-                    kern[bbpi, bbp] += E[bp]-E[b]
+                    plan.add_energy(bbp, bbpi, b, bp)
+                    plan.add_energy(bbpi, bbp, bp, b)
                 # --------------------------------------------------
                 for a, ap in itertools.product(si.statesdm[acharge], si.statesdm[acharge]):
                     aap = si.get_ind_dm0(a, ap, acharge)
                     if aap != -1:
                         bpap = si.get_ind_dm1(bp, ap, acharge)
                         ba = si.get_ind_dm1(b, a, acharge)
-                        fct_aap = 0
+                        fct_aap = plan.new_fct()
                         for l in range(nleads):
-                            fct_aap += (+ Tba[l, b, a]*Tba[l, ap, bp]*phi1fct[l, bpap, 0].conjugate()
-                                        - Tba[l, b, a]*Tba[l, ap, bp]*phi1fct[l, ba, 0])
+                            plan.add_term(fct_aap, [tind(l, b, a), tind(l, ap, bp), find(l, bpap, 0)],
+                                          [False, False, True], +1)
+                            plan.add_term(fct_aap, [tind(l, b, a), tind(l, ap, bp), find(l, ba, 0)],
+                                          [False, False, False], -1)
                         aapi = ndm0 + aap - npauli
                         aap_sgn = +1 if si.get_ind_dm0(a, ap, acharge, maptype=3) else -1
-                        kern[bbp, aap] += fct_aap.imag
-                        if aapi >= ndm0:
-                            kern[bbp, aapi] += fct_aap.real*aap_sgn
-                            if bbpi_bool:
-                                kern[bbpi, aapi] += fct_aap.imag*aap_sgn
-                        if bbpi_bool:
-                            kern[bbpi, aap] -= fct_aap.real
+                        add_dm0_entries(plan, si, bbp, bbpi, bbpi_bool, aap, aapi, aap_sgn, fct_aap)
                 # --------------------------------------------------
                 for bpp in si.statesdm[bcharge]:
                     bppbp = si.get_ind_dm0(bpp, bp, bcharge)
                     if bppbp != -1:
-                        fct_bppbp = 0
+                        fct_bppbp = plan.new_fct()
                         for a in si.statesdm[acharge]:
                             bppa = si.get_ind_dm1(bpp, a, acharge)
                             for l in range(nleads):
-                                fct_bppbp += +Tba[l, b, a]*Tba[l, a, bpp]*phi1fct[l, bppa, 1].conjugate()
+                                plan.add_term(fct_bppbp, [tind(l, b, a), tind(l, a, bpp), find(l, bppa, 1)],
+                                              [False, False, True], +1)
                         for c in si.statesdm[ccharge]:
                             cbpp = si.get_ind_dm1(c, bpp, bcharge)
                             for l in range(nleads):
-                                fct_bppbp += +Tba[l, b, c]*Tba[l, c, bpp]*phi1fct[l, cbpp, 0]
+                                plan.add_term(fct_bppbp, [tind(l, b, c), tind(l, c, bpp), find(l, cbpp, 0)],
+                                              [False, False, False], +1)
                         bppbpi = ndm0 + bppbp - npauli
                         bppbp_sgn = +1 if si.get_ind_dm0(bpp, bp, bcharge, maptype=3) else -1
-                        kern[bbp, bppbp] += fct_bppbp.imag
-                        if bppbpi >= ndm0:
-                            kern[bbp, bppbpi] += fct_bppbp.real*bppbp_sgn
-                            if bbpi_bool:
-                                kern[bbpi, bppbpi] += fct_bppbp.imag*bppbp_sgn
-                        if bbpi_bool:
-                            kern[bbpi, bppbp] -= fct_bppbp.real
+                        add_dm0_entries(plan, si, bbp, bbpi, bbpi_bool, bppbp, bppbpi, bppbp_sgn, fct_bppbp)
                     # --------------------------------------------------
                     bbpp = si.get_ind_dm0(b, bpp, bcharge)
                     if bbpp != -1:
-                        fct_bbpp = 0
+                        fct_bbpp = plan.new_fct()
                         for a in si.statesdm[acharge]:
                             bppa = si.get_ind_dm1(bpp, a, acharge)
                             for l in range(nleads):
-                                fct_bbpp += -Tba[l, bpp, a]*Tba[l, a, bp]*phi1fct[l, bppa, 1]
+                                plan.add_term(fct_bbpp, [tind(l, bpp, a), tind(l, a, bp), find(l, bppa, 1)],
+                                              [False, False, False], -1)
                         for c in si.statesdm[ccharge]:
                             cbpp = si.get_ind_dm1(c, bpp, bcharge)
                             for l in range(nleads):
-                                fct_bbpp += -Tba[l, bpp, c]*Tba[l, c, bp]*phi1fct[l, cbpp, 0].conjugate()
+                                plan.add_term(fct_bbpp, [tind(l, bpp, c), tind(l, c, bp), find(l, cbpp, 0)],
+                                              [False, False, True], -1)
                         bbppi = ndm0 + bbpp - npauli
                         bbpp_sgn = +1 if si.get_ind_dm0(b, bpp, bcharge, maptype=3) else -1
-                        kern[bbp, bbpp] += fct_bbpp.imag
-                        if bbppi >= ndm0:
-                            kern[bbp, bbppi] += fct_bbpp.real*bbpp_sgn
-                            if bbpi_bool:
-                                kern[bbpi, bbppi] += fct_bbpp.imag*bbpp_sgn
-                        if bbpi_bool:
-                            kern[bbpi, bbpp] -= fct_bbpp.real
+                        add_dm0_entries(plan, si, bbp, bbpi, bbpi_bool, bbpp, bbppi, bbpp_sgn, fct_bbpp)
                 # --------------------------------------------------
                 for c, cp in itertools.product(si.statesdm[ccharge], si.statesdm[ccharge]):
                     ccp = si.get_ind_dm0(c, cp, ccharge)
                     if ccp != -1:
                         cpbp = si.get_ind_dm1(cp, bp, bcharge)
                         cb = si.get_ind_dm1(c, b, bcharge)
-                        fct_ccp = 0
+                        fct_ccp = plan.new_fct()
                         for l in range(nleads):
-                            fct_ccp += (+ Tba[l, b, c]*Tba[l, cp, bp]*phi1fct[l, cpbp, 1]
-                                        - Tba[l, b, c]*Tba[l, cp, bp]*phi1fct[l, cb, 1].conjugate())
+                            plan.add_term(fct_ccp, [tind(l, b, c), tind(l, cp, bp), find(l, cpbp, 1)],
+                                          [False, False, False], +1)
+                            plan.add_term(fct_ccp, [tind(l, b, c), tind(l, cp, bp), find(l, cb, 1)],
+                                          [False, False, True], -1)
                         ccpi = ndm0 + ccp - npauli
                         ccp_sgn = +1 if si.get_ind_dm0(c, cp, ccharge, maptype=3) else -1
-                        kern[bbp, ccp] += fct_ccp.imag
-                        if ccpi >= ndm0:
-                            kern[bbp, ccpi] += fct_ccp.real*ccp_sgn
-                            if bbpi_bool:
-                                kern[bbpi, ccpi] += fct_ccp.imag*ccp_sgn
-                        if bbpi_bool:
-                            kern[bbpi, ccp] -= fct_ccp.real
+                        add_dm0_entries(plan, si, bbp, bbpi, bbpi_bool, ccp, ccpi, ccp_sgn, fct_ccp)
                 # --------------------------------------------------
+    return plan
+
+
+def generate_kern_redfield(self):
+    (E, Tba, phi1fct, si) = (self.qd.Ea, self.leads.Tba, self.phi1fct, self.si)
+
+    kh = KernelHandler(self, si.ndm0r)
+
+    generate_norm_vec(self, si.ndm0r)
+    get_plan(self, make_plan_redfield).assemble(kh, [Tba, Tba, phi1fct], E)
+    kh.finalize()
     return 0
 
 
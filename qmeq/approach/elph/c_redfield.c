@@ -0,0 +1,10800 @@
+/* Generated by Cython 0.29.37 */
+
+/* BEGIN: Cython Metadata
+{
+    "distutils": {
+        "depends": [],
+        "name": "qmeq.approach.elph.c_redfield",
+        "sources": [
+            "qmeq/approach/elph/c_redfield.pyx"
+        ]
+    },
+    "module_name": "qmeq.approach.elph.c_redfield"
+}
+END: Cython Metadata */
+
+#ifndef PY_SSIZE_T_CLEAN
+#define PY_SSIZE_T_CLEAN
+#endif /* PY_SSIZE_T_CLEAN */
+#include "Python.h"
+#ifndef Py_PYTHON_H
+    #error Python headers needed to compile C extensions, please install development version of Python.
+#elif PY_VERSION_HEX < 0x02060000 || (0x03000000 <= PY_VERSION_HEX && PY_VERSION_HEX < 0x03030000)
+    #error Cython requires Python 2.6+ or Python 3.3+.
+#else
+#define CYTHON_ABI "0_29_37"
+#define CYTHON_HEX_VERSION 0x001D25F0
+#define CYTHON_FUTURE_DIVISION 1
+#include <stddef.h>
+#ifndef offsetof
+  #define offsetof(type, member) ( (size_t) & ((type*)0) -> member )
+#endif
+#if !defined(WIN32) && !defined(MS_WINDOWS)
+  #ifndef __stdcall
+    #define __stdcall
+  #endif
+  #ifndef __cdecl
+    #define __cdecl
+  #endif
+  #ifndef __fastcall
+    #define __fastcall
+  #endif
+#endif
+#ifndef DL_IMPORT
+  #define DL_IMPORT(t) t
+#endif
+#ifndef DL_EXPORT
+  #define DL_EXPORT(t) t
+#endif
+#define __PYX_COMMA ,
+#ifndef HAVE_LONG_LONG
+  #if PY_VERSION_HEX >= 0x02070000
+    #define HAVE_LONG_LONG
+  #endif
+#endif
+#ifndef PY_LONG_LONG
+  #define PY_LONG_LONG LONG_LONG
+#endif
+#ifndef Py_HUGE_VAL
+  #define Py_HUGE_VAL HUGE_VAL
+#endif
+#ifdef PYPY_VERSION
+  #define CYTHON_COMPILING_IN_PYPY 1
+  #define CYTHON_COMPILING_IN_PYSTON 0
+  #define CYTHON_COMPILING_IN_CPYTHON 0
+  #define CYTHON_COMPILING_IN_NOGIL 0
+  #undef CYTHON_USE_TYPE_SLOTS
+  #define CYTHON_USE_TYPE_SLOTS 0
+  #undef CYTHON_USE_PYTYPE_LOOKUP
+  #define CYTHON_USE_PYTYPE_LOOKUP 0
+  #if PY_VERSION_HEX < 0x03050000
+    #undef CYTHON_USE_ASYNC_SLOTS
+    #define CYTHON_USE_ASYNC_SLOTS 0
+  #elif !defined(CYTHON_USE_ASYNC_SLOTS)
+    #define CYTHON_USE_ASYNC_SLOTS 1
+  #endif
+  #undef CYTHON_USE_PYLIST_INTERNALS
+  #define CYTHON_USE_PYLIST_INTERNALS 0
+  #undef CYTHON_USE_UNICODE_INTERNALS
+  #define CYTHON_USE_UNICODE_INTERNALS 0
+  #undef CYTHON_USE_UNICODE_WRITER
+  #define CYTHON_USE_UNICODE_WRITER 0
+  #undef CYTHON_USE_PYLONG_INTERNALS
+  #define CYTHON_USE_PYLONG_INTERNALS 0
+  #undef CYTHON_AVOID_BORROWED_REFS
+  #define CYTHON_AVOID_BORROWED_REFS 1
+  #undef CYTHON_ASSUME_SAFE_MACROS
+  #define CYTHON_ASSUME_SAFE_MACROS 0
+  #undef CYTHON_UNPACK_METHODS
+  #define CYTHON_UNPACK_METHODS 0
+  #undef CYTHON_FAST_THREAD_STATE
+  #define CYTHON_FAST_THREAD_STATE 0
+  #undef CYTHON_FAST_PYCALL
+  #define CYTHON_FAST_PYCALL 0
+  #if PY_VERSION_HEX < 0x03090000
+    #undef CYTHON_PEP489_MULTI_PHASE_INIT
+    #define CYTHON_PEP489_MULTI_PHASE_INIT 0
+  #elif !defined(CYTHON_PEP489_MULTI_PHASE_INIT)
+    #define CYTHON_PEP489_MULTI_PHASE_INIT 1
+  #endif
+  #undef CYTHON_USE_TP_FINALIZE
+  #define CYTHON_USE_TP_FINALIZE (PY_VERSION_HEX >= 0x030400a1 && PYPY_VERSION_NUM >= 0x07030C00)
+  #undef CYTHON_USE_DICT_VERSIONS
+  #define CYTHON_USE_DICT_VERSIONS 0
+  #undef CYTHON_USE_EXC_INFO_STACK
+  #define CYTHON_USE_EXC_INFO_STACK 0
+  #ifndef CYTHON_UPDATE_DESCRIPTOR_DOC
+    #define CYTHON_UPDATE_DESCRIPTOR_DOC 0
+  #endif
+#elif defined(PYSTON_VERSION)
+  #define CYTHON_COMPILING_IN_PYPY 0
+  #define CYTHON_COMPILING_IN_PYSTON 1
+  #define CYTHON_COMPILING_IN_CPYTHON 0
+  #define CYTHON_COMPILING_IN_NOGIL 0
+  #ifndef CYTHON_USE_TYPE_SLOTS
+    #define CYTHON_USE_TYPE_SLOTS 1
+  #endif
+  #undef CYTHON_USE_PYTYPE_LOOKUP
+  #define CYTHON_USE_PYTYPE_LOOKUP 0
+  #undef CYTHON_USE_ASYNC_SLOTS
+  #define CYTHON_USE_ASYNC_SLOTS 0
+  #undef CYTHON_USE_PYLIST_INTERNALS
+  #define CYTHON_USE_PYLIST_INTERNALS 0
+  #ifndef CYTHON_USE_UNICODE_INTERNALS
+    #define CYTHON_USE_UNICODE_INTERNALS 1
+  #endif
+  #undef CYTHON_USE_UNICODE_WRITER
+  #define CYTHON_USE_UNICODE_WRITER 0
+  #undef CYTHON_USE_PYLONG_INTERNALS
+  #define CYTHON_USE_PYLONG_INTERNALS 0
+  #ifndef CYTHON_AVOID_BORROWED_REFS
+    #define CYTHON_AVOID_BORROWED_REFS 0
+  #endif
+  #ifndef CYTHON_ASSUME_SAFE_MACROS
+    #define CYTHON_ASSUME_SAFE_MACROS 1
+  #endif
+  #ifndef CYTHON_UNPACK_METHODS
+    #define CYTHON_UNPACK_METHODS 1
+  #endif
+  #undef CYTHON_FAST_THREAD_STATE
+  #define CYTHON_FAST_THREAD_STATE 0
+  #undef CYTHON_FAST_PYCALL
+  #define CYTHON_FAST_PYCALL 0
+  #undef CYTHON_PEP489_MULTI_PHASE_INIT
+  #define CYTHON_PEP489_MULTI_PHASE_INIT 0
+  #undef CYTHON_USE_TP_FINALIZE
+  #define CYTHON_USE_TP_FINALIZE 0
+  #undef CYTHON_USE_DICT_VERSIONS
+  #define CYTHON_USE_DICT_VERSIONS 0
+  #undef CYTHON_USE_EXC_INFO_STACK
+  #define CYTHON_USE_EXC_INFO_STACK 0
+  #ifndef CYTHON_UPDATE_DESCRIPTOR_DOC
+    #define CYTHON_UPDATE_DESCRIPTOR_DOC 0
+  #endif
+#elif defined(PY_NOGIL)
+  #define CYTHON_COMPILING_IN_PYPY 0
+  #define CYTHON_COMPILING_IN_PYSTON 0
+  #define CYTHON_COMPILING_IN_CPYTHON 0
+  #define CYTHON_COMPILING_IN_NOGIL 1
+  #ifndef CYTHON_USE_TYPE_SLOTS
+    #define CYTHON_USE_TYPE_SLOTS 1
+  #endif
+  #undef CYTHON_USE_PYTYPE_LOOKUP
+  #define CYTHON_USE_PYTYPE_LOOKUP 0
+  #ifndef CYTHON_USE_ASYNC_SLOTS
+    #define CYTHON_USE_ASYNC_SLOTS 1
+  #endif
+  #undef CYTHON_USE_PYLIST_INTERNALS
+  #define CYTHON_USE_PYLIST_INTERNALS 0
+  #ifndef CYTHON_USE_UNICODE_INTERNALS
+    #define CYTHON_USE_UNICODE_INTERNALS 1
+  #endif
+  #undef CYTHON_USE_UNICODE_WRITER
+  #define CYTHON_USE_UNICODE_WRITER 0
+  #undef CYTHON_USE_PYLONG_INTERNALS
+  #define CYTHON_USE_PYLONG_INTERNALS 0
+  #ifndef CYTHON_AVOID_BORROWED_REFS
+    #define CYTHON_AVOID_BORROWED_REFS 0
+  #endif
+  #ifndef CYTHON_ASSUME_SAFE_MACROS
+    #define CYTHON_ASSUME_SAFE_MACROS 1
+  #endif
+  #ifndef CYTHON_UNPACK_METHODS
+    #define CYTHON_UNPACK_METHODS 1
+  #endif
+  #undef CYTHON_FAST_THREAD_STATE
+  #define CYTHON_FAST_THREAD_STATE 0
+  #undef CYTHON_FAST_PYCALL
+  #define CYTHON_FAST_PYCALL 0
+  #ifndef CYTHON_PEP489_MULTI_PHASE_INIT
+    #define CYTHON_PEP489_MULTI_PHASE_INIT 1
+  #endif
+  #ifndef CYTHON_USE_TP_FINALIZE
+    #define CYTHON_USE_TP_FINALIZE 1
+  #endif
+  #undef CYTHON_USE_DICT_VERSIONS
+  #define CYTHON_USE_DICT_VERSIONS 0
+  #undef CYTHON_USE_EXC_INFO_STACK
+  #define CYTHON_USE_EXC_INFO_STACK 0
+#else
+  #define CYTHON_COMPILING_IN_PYPY 0
+  #define CYTHON_COMPILING_IN_PYSTON 0
+  #define CYTHON_COMPILING_IN_CPYTHON 1
+  #define CYTHON_COMPILING_IN_NOGIL 0
+  #ifndef CYTHON_USE_TYPE_SLOTS
+    #define CYTHON_USE_TYPE_SLOTS 1
+  #endif
+  #if PY_VERSION_HEX < 0x02070000
+    #undef CYTHON_USE_PYTYPE_LOOKUP
+    #define CYTHON_USE_PYTYPE_LOOKUP 0
+  #elif !defined(CYTHON_USE_PYTYPE_LOOKUP)
+    #define CYTHON_USE_PYTYPE_LOOKUP 1
+  #endif
+  #if PY_MAJOR_VERSION < 3
+    #undef CYTHON_USE_ASYNC_SLOTS
+    #define CYTHON_USE_ASYNC_SLOTS 0
+  #elif !defined(CYTHON_USE_ASYNC_SLOTS)
+    #define CYTHON_USE_ASYNC_SLOTS 1
+  #endif
+  #if PY_VERSION_HEX < 0x02070000
+    #undef CYTHON_USE_PYLONG_INTERNALS
+    #define CYTHON_USE_PYLONG_INTERNALS 0
+  #elif !defined(CYTHON_USE_PYLONG_INTERNALS)
+    #define CYTHON_USE_PYLONG_INTERNALS (PY_VERSION_HEX < 0x030C00A5)
+  #endif
+  #ifndef CYTHON_USE_PYLIST_INTERNALS
+    #define CYTHON_USE_PYLIST_INTERNALS 1
+  #endif
+  #ifndef CYTHON_USE_UNICODE_INTERNALS
+    #define CYTHON_USE_UNICODE_INTERNALS 1
+  #endif
+  #if PY_VERSION_HEX < 0x030300F0 || PY_VERSION_HEX >= 0x030B00A2
+    #undef CYTHON_USE_UNICODE_WRITER
+    #define CYTHON_USE_UNICODE_WRITER 0
+  #elif !defined(CYTHON_USE_UNICODE_WRITER)
+    #define CYTHON_USE_UNICODE_WRITER 1
+  #endif
+  #ifndef CYTHON_AVOID_BORROWED_REFS
+    #define CYTHON_AVOID_BORROWED_REFS 0
+  #endif
+  #ifndef CYTHON_ASSUME_SAFE_MACROS
+    #define CYTHON_ASSUME_SAFE_MACROS 1
+  #endif
+  #ifndef CYTHON_UNPACK_METHODS
+    #define CYTHON_UNPACK_METHODS 1
+  #endif
+  #if PY_VERSION_HEX >= 0x030B00A4
+    #undef CYTHON_FAST_THREAD_STATE
+    #define CYTHON_FAST_THREAD_STATE 0
+  #elif !defined(CYTHON_FAST_THREAD_STATE)
+    #define CYTHON_FAST_THREAD_STATE 1
+  #endif
+  #ifndef CYTHON_FAST_PYCALL
+    #define CYTHON_FAST_PYCALL (PY_VERSION_HEX < 0x030A0000)
+  #endif
+  #ifndef CYTHON_PEP489_MULTI_PHASE_INIT
+    #define CYTHON_PEP489_MULTI_PHASE_INIT (PY_VERSION_HEX >= 0x03050000)
+  #endif
+  #ifndef CYTHON_USE_TP_FINALIZE
+    #define CYTHON_USE_TP_FINALIZE (PY_VERSION_HEX >= 0x030400a1)
+  #endif
+  #ifndef CYTHON_USE_DICT_VERSIONS
+    #define CYTHON_USE_DICT_VERSIONS ((PY_VERSION_HEX >= 0x030600B1) && (PY_VERSION_HEX < 0x030C00A5))
+  #endif
+  #if PY_VERSION_HEX >= 0x030B00A4
+    #undef CYTHON_USE_EXC_INFO_STACK
+    #define CYTHON_USE_EXC_INFO_STACK 0
+  #elif !defined(CYTHON_USE_EXC_INFO_STACK)
+    #define CYTHON_USE_EXC_INFO_STACK (PY_VERSION_HEX >= 0x030700A3)
+  #endif
+  #ifndef CYTHON_UPDATE_DESCRIPTOR_DOC
+    #define CYTHON_UPDATE_DESCRIPTOR_DOC 1
+  #endif
+#endif
+#if !defined(CYTHON_FAST_PYCCALL)
+#define CYTHON_FAST_PYCCALL  (CYTHON_FAST_PYCALL && PY_VERSION_HEX >= 0x030600B1)
+#endif
+#if CYTHON_USE_PYLONG_INTERNALS
+  #if PY_MAJOR_VERSION < 3
+    #include "longintrepr.h"
+  #endif
+  #undef SHIFT
+  #undef BASE
+  #undef MASK
+  #ifdef SIZEOF_VOID_P
+    enum { __pyx_check_sizeof_voidp = 1 / (int)(SIZEOF_VOID_P == sizeof(void*)) };
+  #endif
+#endif
+#ifndef __has_attribute
+  #define __has_attribute(x) 0
+#endif
+#ifndef __has_cpp_attribute
+  #define __has_cpp_attribute(x) 0
+#endif
+#ifndef CYTHON_RESTRICT
+  #if defined(__GNUC__)
+    #define CYTHON_RESTRICT __restrict__
+  #elif defined(_MSC_VER) && _MSC_VER >= 1400
+    #define CYTHON_RESTRICT __restrict
+  #elif defined (__STDC_VERSION__) && __STDC_VERSION__ >= 199901L
+    #define CYTHON_RESTRICT restrict
+  #else
+    #define CYTHON_RESTRICT
+  #endif
+#endif
+#ifndef CYTHON_UNUSED
+# if defined(__GNUC__)
+#   if !(defined(__cplusplus)) || (__GNUC__ > 3 || (__GNUC__ == 3 && __GNUC_MINOR__ >= 4))
+#     define CYTHON_UNUSED __attribute__ ((__unused__))
+#   else
+#     define CYTHON_UNUSED
+#   endif
+# elif defined(__ICC) || (defined(__INTEL_COMPILER) && !defined(_MSC_VER))
+#   define CYTHON_UNUSED __attribute__ ((__unused__))
+# else
+#   define CYTHON_UNUSED
+# endif
+#endif
+#ifndef CYTHON_MAYBE_UNUSED_VAR
+#  if defined(__cplusplus)
+     template<class T> void CYTHON_MAYBE_UNUSED_VAR( const T& ) { }
+#  else
+#    define CYTHON_MAYBE_UNUSED_VAR(x) (void)(x)
+#  endif
+#endif
+#ifndef CYTHON_NCP_UNUSED
+# if CYTHON_COMPILING_IN_CPYTHON
+#  define CYTHON_NCP_UNUSED
+# else
+#  define CYTHON_NCP_UNUSED CYTHON_UNUSED
+# endif
+#endif
+#define __Pyx_void_to_None(void_result) ((void)(void_result), Py_INCREF(Py_None), Py_None)
+#ifdef _MSC_VER
+    #ifndef _MSC_STDINT_H_
+        #if _MSC_VER < 1300
+           typedef unsigned char     uint8_t;
+           typedef unsigned int      uint32_t;
+        #else
+           typedef unsigned __int8   uint8_t;
+           typedef unsigned __int32  uint32_t;
+        #endif
+    #endif
+#else
+   #include <stdint.h>
+#endif
+#ifndef CYTHON_FALLTHROUGH
+  #if defined(__cplusplus) && __cplusplus >= 201103L
+    #if __has_cpp_attribute(fallthrough)
+      #define CYTHON_FALLTHROUGH [[fallthrough]]
+    #elif __has_cpp_attribute(clang::fallthrough)
+      #define CYTHON_FALLTHROUGH [[clang::fallthrough]]
+    #elif __has_cpp_attribute(gnu::fallthrough)
+      #define CYTHON_FALLTHROUGH [[gnu::fallthrough]]
+    #endif
+  #endif
+  #ifndef CYTHON_FALLTHROUGH
+    #if __has_attribute(fallthrough)
+      #define CYTHON_FALLTHROUGH __attribute__((fallthrough))
+    #else
+      #define CYTHON_FALLTHROUGH
+    #endif
+  #endif
+  #if defined(__clang__ ) && defined(__apple_build_version__)
+    #if __apple_build_version__ < 7000000
+      #undef  CYTHON_FALLTHROUGH
+      #define CYTHON_FALLTHROUGH
+    #endif
+  #endif
+#endif
+
+#ifndef CYTHON_INLINE
+  #if defined(__clang__)
+    #define CYTHON_INLINE __inline__ __attribute__ ((__unused__))
+  #elif defined(__GNUC__)
+    #define CYTHON_INLINE __inline__
+  #elif defined(_MSC_VER)
+    #define CYTHON_INLINE __inline
+  #elif defined (__STDC_VERSION__) && __STDC_VERSION__ >= 199901L
+    #define CYTHON_INLINE inline
+  #else
+    #define CYTHON_INLINE
+  #endif
+#endif
+
+#define __PYX_BUILD_PY_SSIZE_T "n"
+#define CYTHON_FORMAT_SSIZE_T "z"
+#if PY_MAJOR_VERSION < 3
+  #define __Pyx_BUILTIN_MODULE_NAME "__builtin__"
+  #define __Pyx_PyCode_New(a, k, l, s, f, code, c, n, v, fv, cell, fn, name, fline, lnos)\
+          PyCode_New(a+k, l, s, f, code, c, n, v, fv, cell, fn, name, fline, lnos)
+  #define __Pyx_DefaultClassType PyClass_Type
+#else
+  #define __Pyx_BUILTIN_MODULE_NAME "builtins"
+  #define __Pyx_DefaultClassType PyType_Type
+#if PY_VERSION_HEX >= 0x030B00A1
+    static CYTHON_INLINE PyCodeObject* __Pyx_PyCode_New(int a, int k, int l, int s, int f,
+                                                    PyObject *code, PyObject *c, PyObject* n, PyObject *v,
+                                                    PyObject *fv, PyObject *cell, PyObject* fn,
+                                                    PyObject *name, int fline, PyObject *lnos) {
+        PyObject *kwds=NULL, *argcount=NULL, *posonlyargcount=NULL, *kwonlyargcount=NULL;
+        PyObject *nlocals=NULL, *stacksize=NULL, *flags=NULL, *replace=NULL, *call_result=NULL, *empty=NULL;
+        const char *fn_cstr=NULL;
+        const char *name_cstr=NULL;
+        PyCodeObject* co=NULL;
+        PyObject *type, *value, *traceback;
+        PyErr_Fetch(&type, &value, &traceback);
+        if (!(kwds=PyDict_New())) goto end;
+        if (!(argcount=PyLong_FromLong(a))) goto end;
+        if (PyDict_SetItemString(kwds, "co_argcount", argcount) != 0) goto end;
+        if (!(posonlyargcount=PyLong_FromLong(0))) goto end;
+        if (PyDict_SetItemString(kwds, "co_posonlyargcount", posonlyargcount) != 0) goto end;
+        if (!(kwonlyargcount=PyLong_FromLong(k))) goto end;
+        if (PyDict_SetItemString(kwds, "co_kwonlyargcount", kwonlyargcount) != 0) goto end;
+        if (!(nlocals=PyLong_FromLong(l))) goto end;
+        if (PyDict_SetItemString(kwds, "co_nlocals", nlocals) != 0) goto end;
+        if (!(stacksize=PyLong_FromLong(s))) goto end;
+        if (PyDict_SetItemString(kwds, "co_stacksize", stacksize) != 0) goto end;
+        if (!(flags=PyLong_FromLong(f))) goto end;
+        if (PyDict_SetItemString(kwds, "co_flags", flags) != 0) goto end;
+        if (PyDict_SetItemString(kwds, "co_code", code) != 0) goto end;
+        if (PyDict_SetItemString(kwds, "co_consts", c) != 0) goto end;
+        if (PyDict_SetItemString(kwds, "co_names", n) != 0) goto end;
+        if (PyDict_SetItemString(kwds, "co_varnames", v) != 0) goto end;
+        if (PyDict_SetItemString(kwds, "co_freevars", fv) != 0) goto end;
+        if (PyDict_SetItemString(kwds, "co_cellvars", cell) != 0) goto end;
+        if (PyDict_SetItemString(kwds, "co_linetable", lnos) != 0) goto end;
+        if (!(fn_cstr=PyUnicode_AsUTF8AndSize(fn, NULL))) goto end;
+        if (!(name_cstr=PyUnicode_AsUTF8AndSize(name, NULL))) goto end;
+        if (!(co = PyCode_NewEmpty(fn_cstr, name_cstr, fline))) goto end;
+        if (!(replace = PyObject_GetAttrString((PyObject*)co, "replace"))) goto cleanup_code_too;
+        if (!(empty = PyTuple_New(0))) goto cleanup_code_too; // unfortunately __pyx_empty_tuple isn't available here
+        if (!(call_result = PyObject_Call(replace, empty, kwds))) goto cleanup_code_too;
+        Py_XDECREF((PyObject*)co);
+        co = (PyCodeObject*)call_result;
+        call_result = NULL;
+        if (0) {
+            cleanup_code_too:
+            Py_XDECREF((PyObject*)co);
+            co = NULL;
+        }
+        end:
+        Py_XDECREF(kwds);
+        Py_XDECREF(argcount);
+        Py_XDECREF(posonlyargcount);
+        Py_XDECREF(kwonlyargcount);
+        Py_XDECREF(nlocals);
+        Py_XDECREF(stacksize);
+        Py_XDECREF(replace);
+        Py_XDECREF(call_result);
+        Py_XDECREF(empty);
+        if (type) {
+            PyErr_Restore(type, value, traceback);
+        }
+        return co;
+    }
+#else
+  #define __Pyx_PyCode_New(a, k, l, s, f, code, c, n, v, fv, cell, fn, name, fline, lnos)\
+          PyCode_New(a, k, l, s, f, code, c, n, v, fv, cell, fn, name, fline, lnos)
+#endif
+  #define __Pyx_DefaultClassType PyType_Type
+#endif
+#if PY_VERSION_HEX >= 0x030900F0 && !CYTHON_COMPILING_IN_PYPY
+  #define __Pyx_PyObject_GC_IsFinalized(o) PyObject_GC_IsFinalized(o)
+#else
+  #define __Pyx_PyObject_GC_IsFinalized(o) _PyGC_FINALIZED(o)
+#endif
+#ifndef Py_TPFLAGS_CHECKTYPES
+  #define Py_TPFLAGS_CHECKTYPES 0
+#endif
+#ifndef Py_TPFLAGS_HAVE_INDEX
+  #define Py_TPFLAGS_HAVE_INDEX 0
+#endif
+#ifndef Py_TPFLAGS_HAVE_NEWBUFFER
+  #define Py_TPFLAGS_HAVE_NEWBUFFER 0
+#endif
+#ifndef Py_TPFLAGS_HAVE_FINALIZE
+  #define Py_TPFLAGS_HAVE_FINALIZE 0
+#endif
+#ifndef METH_STACKLESS
+  #define METH_STACKLESS 0
+#endif
+#if PY_VERSION_HEX <= 0x030700A3 || !defined(METH_FASTCALL)
+  #ifndef METH_FASTCALL
+     #define METH_FASTCALL 0x80
+  #endif
+  typedef PyObject *(*__Pyx_PyCFunctionFast) (PyObject *self, PyObject *const *args, Py_ssize_t nargs);
+  typedef PyObject *(*__Pyx_PyCFunctionFastWithKeywords) (PyObject *self, PyObject *const *args,
+                                                          Py_ssize_t nargs, PyObject *kwnames);
+#else
+  #define __Pyx_PyCFunctionFast _PyCFunctionFast
+  #define __Pyx_PyCFunctionFastWithKeywords _PyCFunctionFastWithKeywords
+#endif
+#if CYTHON_FAST_PYCCALL
+#define __Pyx_PyFastCFunction_Check(func)\
+    ((PyCFunction_Check(func) && (METH_FASTCALL == (PyCFunction_GET_FLAGS(func) & ~(METH_CLASS | METH_STATIC | METH_COEXIST | METH_KEYWORDS | METH_STACKLESS)))))
+#else
+#define __Pyx_PyFastCFunction_Check(func) 0
+#endif
+#if CYTHON_COMPILING_IN_PYPY && !defined(PyObject_Malloc)
+  #define PyObject_Malloc(s)   PyMem_Malloc(s)
+  #define PyObject_Free(p)     PyMem_Free(p)
+  #define PyObject_Realloc(p)  PyMem_Realloc(p)
+#endif
+#if CYTHON_COMPILING_IN_CPYTHON && PY_VERSION_HEX < 0x030400A1
+  #define PyMem_RawMalloc(n)           PyMem_Malloc(n)
+  #define PyMem_RawRealloc(p, n)       PyMem_Realloc(p, n)
+  #define PyMem_RawFree(p)             PyMem_Free(p)
+#endif
+#if CYTHON_COMPILING_IN_PYSTON
+  #define __Pyx_PyCode_HasFreeVars(co)  PyCode_HasFreeVars(co)
+  #define __Pyx_PyFrame_SetLineNumber(frame, lineno) PyFrame_SetLineNumber(frame, lineno)
+#else
+  #define __Pyx_PyCode_HasFreeVars(co)  (PyCode_GetNumFree(co) > 0)
+  #define __Pyx_PyFrame_SetLineNumber(frame, lineno)  (frame)->f_lineno = (lineno)
+#endif
+#if !CYTHON_FAST_THREAD_STATE || PY_VERSION_HEX < 0x02070000
+  #define __Pyx_PyThreadState_Current PyThreadState_GET()
+#elif PY_VERSION_HEX >= 0x03060000
+  #define __Pyx_PyThreadState_Current _PyThreadState_UncheckedGet()
+#elif PY_VERSION_HEX >= 0x03000000
+  #define __Pyx_PyThreadState_Current PyThreadState_GET()
+#else
+  #define __Pyx_PyThreadState_Current _PyThreadState_Current
+#endif
+#if PY_VERSION_HEX < 0x030700A2 && !defined(PyThread_tss_create) && !defined(Py_tss_NEEDS_INIT)
+#include "pythread.h"
+#define Py_tss_NEEDS_INIT 0
+typedef int Py_tss_t;
+static CYTHON_INLINE int PyThread_tss_create(Py_tss_t *key) {
+  *key = PyThread_create_key();
+  return 0;
+}
+static CYTHON_INLINE Py_tss_t * PyThread_tss_alloc(void) {
+  Py_tss_t *key = (Py_tss_t *)PyObject_Malloc(sizeof(Py_tss_t));
+  *key = Py_tss_NEEDS_INIT;
+  return key;
+}
+static CYTHON_INLINE void PyThread_tss_free(Py_tss_t *key) {
+  PyObject_Free(key);
+}
+static CYTHON_INLINE int PyThread_tss_is_created(Py_tss_t *key) {
+  return *key != Py_tss_NEEDS_INIT;
+}
+static CYTHON_INLINE void PyThread_tss_delete(Py_tss_t *key) {
+  PyThread_delete_key(*key);
+  *key = Py_tss_NEEDS_INIT;
+}
+static CYTHON_INLINE int PyThread_tss_set(Py_tss_t *key, void *value) {
+  return PyThread_set_key_value(*key, value);
+}
+static CYTHON_INLINE void * PyThread_tss_get(Py_tss_t *key) {
+  return PyThread_get_key_value(*key);
+}
+#endif
+#if CYTHON_COMPILING_IN_CPYTHON || defined(_PyDict_NewPresized)
+#define __Pyx_PyDict_NewPresized(n)  ((n <= 8) ? PyDict_New() : _PyDict_NewPresized(n))
+#else
+#define __Pyx_PyDict_NewPresized(n)  PyDict_New()
+#endif
+#if PY_MAJOR_VERSION >= 3 || CYTHON_FUTURE_DIVISION
+  #define __Pyx_PyNumber_Divide(x,y)         PyNumber_TrueDivide(x,y)
+  #define __Pyx_PyNumber_InPlaceDivide(x,y)  PyNumber_InPlaceTrueDivide(x,y)
+#else
+  #define __Pyx_PyNumber_Divide(x,y)         PyNumber_Divide(x,y)
+  #define __Pyx_PyNumber_InPlaceDivide(x,y)  PyNumber_InPlaceDivide(x,y)
+#endif
+#if CYTHON_COMPILING_IN_CPYTHON && PY_VERSION_HEX >= 0x030500A1 && CYTHON_USE_UNICODE_INTERNALS
+#define __Pyx_PyDict_GetItemStr(dict, name)  _PyDict_GetItem_KnownHash(dict, name, ((PyASCIIObject *) name)->hash)
+#else
+#define __Pyx_PyDict_GetItemStr(dict, name)  PyDict_GetItem(dict, name)
+#endif
+#if PY_VERSION_HEX > 0x03030000 && defined(PyUnicode_KIND)
+  #define CYTHON_PEP393_ENABLED 1
+  #if PY_VERSION_HEX >= 0x030C0000
+    #define __Pyx_PyUnicode_READY(op)       (0)
+  #else
+    #define __Pyx_PyUnicode_READY(op)       (likely(PyUnicode_IS_READY(op)) ?\
+                                                0 : _PyUnicode_Ready((PyObject *)(op)))
+  #endif
+  #define __Pyx_PyUnicode_GET_LENGTH(u)   PyUnicode_GET_LENGTH(u)
+  #define __Pyx_PyUnicode_READ_CHAR(u, i) PyUnicode_READ_CHAR(u, i)
+  #define __Pyx_PyUnicode_MAX_CHAR_VALUE(u)   PyUnicode_MAX_CHAR_VALUE(u)
+  #define __Pyx_PyUnicode_KIND(u)         PyUnicode_KIND(u)
+  #define __Pyx_PyUnicode_DATA(u)         PyUnicode_DATA(u)
+  #define __Pyx_PyUnicode_READ(k, d, i)   PyUnicode_READ(k, d, i)
+  #define __Pyx_PyUnicode_WRITE(k, d, i, ch)  PyUnicode_WRITE(k, d, i, ch)
+  #if PY_VERSION_HEX >= 0x030C0000
+    #define __Pyx_PyUnicode_IS_TRUE(u)      (0 != PyUnicode_GET_LENGTH(u))
+  #else
+    #if CYTHON_COMPILING_IN_CPYTHON && PY_VERSION_HEX >= 0x03090000
+    #define __Pyx_PyUnicode_IS_TRUE(u)      (0 != (likely(PyUnicode_IS_READY(u)) ? PyUnicode_GET_LENGTH(u) : ((PyCompactUnicodeObject *)(u))->wstr_length))
+    #else
+    #define __Pyx_PyUnicode_IS_TRUE(u)      (0 != (likely(PyUnicode_IS_READY(u)) ? PyUnicode_GET_LENGTH(u) : PyUnicode_GET_SIZE(u)))
+    #endif
+  #endif
+#else
+  #define CYTHON_PEP393_ENABLED 0
+  #define PyUnicode_1BYTE_KIND  1
+  #define PyUnicode_2BYTE_KIND  2
+  #define PyUnicode_4BYTE_KIND  4
+  #define __Pyx_PyUnicode_READY(op)       (0)
+  #define __Pyx_PyUnicode_GET_LENGTH(u)   PyUnicode_GET_SIZE(u)
+  #define __Pyx_PyUnicode_READ_CHAR(u, i) ((Py_UCS4)(PyUnicode_AS_UNICODE(u)[i]))
+  #define __Pyx_PyUnicode_MAX_CHAR_VALUE(u)   ((sizeof(Py_UNICODE) == 2) ? 65535 : 1114111)
+  #define __Pyx_PyUnicode_KIND(u)         (sizeof(Py_UNICODE))
+  #define __Pyx_PyUnicode_DATA(u)         ((void*)PyUnicode_AS_UNICODE(u))
+  #define __Pyx_PyUnicode_READ(k, d, i)   ((void)(k), (Py_UCS4)(((Py_UNICODE*)d)[i]))
+  #define __Pyx_PyUnicode_WRITE(k, d, i, ch)  (((void)(k)), ((Py_UNICODE*)d)[i] = ch)
+  #define __Pyx_PyUnicode_IS_TRUE(u)      (0 != PyUnicode_GET_SIZE(u))
+#endif
+#if CYTHON_COMPILING_IN_PYPY
+  #define __Pyx_PyUnicode_Concat(a, b)      PyNumber_Add(a, b)
+  #define __Pyx_PyUnicode_ConcatSafe(a, b)  PyNumber_Add(a, b)
+#else
+  #define __Pyx_PyUnicode_Concat(a, b)      PyUnicode_Concat(a, b)
+  #define __Pyx_PyUnicode_ConcatSafe(a, b)  ((unlikely((a) == Py_None) || unlikely((b) == Py_None)) ?\
+      PyNumber_Add(a, b) : __Pyx_PyUnicode_Concat(a, b))
+#endif
+#if CYTHON_COMPILING_IN_PYPY && !defined(PyUnicode_Contains)
+  #define PyUnicode_Contains(u, s)  PySequence_Contains(u, s)
+#endif
+#if CYTHON_COMPILING_IN_PYPY && !defined(PyByteArray_Check)
+  #define PyByteArray_Check(obj)  PyObject_TypeCheck(obj, &PyByteArray_Type)
+#endif
+#if CYTHON_COMPILING_IN_PYPY && !defined(PyObject_Format)
+  #define PyObject_Format(obj, fmt)  PyObject_CallMethod(obj, "__format__", "O", fmt)
+#endif
+#define __Pyx_PyString_FormatSafe(a, b)   ((unlikely((a) == Py_None || (PyString_Check(b) && !PyString_CheckExact(b)))) ? PyNumber_Remainder(a, b) : __Pyx_PyString_Format(a, b))
+#define __Pyx_PyUnicode_FormatSafe(a, b)  ((unlikely((a) == Py_None || (PyUnicode_Check(b) && !PyUnicode_CheckExact(b)))) ? PyNumber_Remainder(a, b) : PyUnicode_Format(a, b))
+#if PY_MAJOR_VERSION >= 3
+  #define __Pyx_PyString_Format(a, b)  PyUnicode_Format(a, b)
+#else
+  #define __Pyx_PyString_Format(a, b)  PyString_Format(a, b)
+#endif
+#if PY_MAJOR_VERSION < 3 && !defined(PyObject_ASCII)
+  #define PyObject_ASCII(o)            PyObject_Repr(o)
+#endif
+#if PY_MAJOR_VERSION >= 3
+  #define PyBaseString_Type            PyUnicode_Type
+  #define PyStringObject               PyUnicodeObject
+  #define PyString_Type                PyUnicode_Type
+  #define PyString_Check               PyUnicode_Check
+  #define PyString_CheckExact          PyUnicode_CheckExact
+#ifndef PyObject_Unicode
+  #define PyObject_Unicode             PyObject_Str
+#endif
+#endif
+#if PY_MAJOR_VERSION >= 3
+  #define __Pyx_PyBaseString_Check(obj) PyUnicode_Check(obj)
+  #define __Pyx_PyBaseString_CheckExact(obj) PyUnicode_CheckExact(obj)
+#else
+  #define __Pyx_PyBaseString_Check(obj) (PyString_Check(obj) || PyUnicode_Check(obj))
+  #define __Pyx_PyBaseString_CheckExact(obj) (PyString_CheckExact(obj) || PyUnicode_CheckExact(obj))
+#endif
+#ifndef PySet_CheckExact
+  #define PySet_CheckExact(obj)        (Py_TYPE(obj) == &PySet_Type)
+#endif
+#if PY_VERSION_HEX >= 0x030900A4
+  #define __Pyx_SET_REFCNT(obj, refcnt) Py_SET_REFCNT(obj, refcnt)
+  #define __Pyx_SET_SIZE(obj, size) Py_SET_SIZE(obj, size)
+#else
+  #define __Pyx_SET_REFCNT(obj, refcnt) Py_REFCNT(obj) = (refcnt)
+  #define __Pyx_SET_SIZE(obj, size) Py_SIZE(obj) = (size)
+#endif
+#if CYTHON_ASSUME_SAFE_MACROS
+  #define __Pyx_PySequence_SIZE(seq)  Py_SIZE(seq)
+#else
+  #define __Pyx_PySequence_SIZE(seq)  PySequence_Size(seq)
+#endif
+#if PY_MAJOR_VERSION >= 3
+  #define PyIntObject                  PyLongObject
+  #define PyInt_Type                   PyLong_Type
+  #define PyInt_Check(op)              PyLong_Check(op)
+  #define PyInt_CheckExact(op)         PyLong_CheckExact(op)
+  #define PyInt_FromString             PyLong_FromString
+  #define PyInt_FromUnicode            PyLong_FromUnicode
+  #define PyInt_FromLong               PyLong_FromLong
+  #define PyInt_FromSize_t             PyLong_FromSize_t
+  #define PyInt_FromSsize_t            PyLong_FromSsize_t
+  #define PyInt_AsLong                 PyLong_AsLong
+  #define PyInt_AS_LONG                PyLong_AS_LONG
+  #define PyInt_AsSsize_t              PyLong_AsSsize_t
+  #define PyInt_AsUnsignedLongMask     PyLong_AsUnsignedLongMask
+  #define PyInt_AsUnsignedLongLongMask PyLong_AsUnsignedLongLongMask
+  #define PyNumber_Int                 PyNumber_Long
+#endif
+#if PY_MAJOR_VERSION >= 3
+  #define PyBoolObject                 PyLongObject
+#endif
+#if PY_MAJOR_VERSION >= 3 && CYTHON_COMPILING_IN_PYPY
+  #ifndef PyUnicode_InternFromString
+    #define PyUnicode_InternFromString(s) PyUnicode_FromString(s)
+  #endif
+#endif
+#if PY_VERSION_HEX < 0x030200A4
+  typedef long Py_hash_t;
+  #define __Pyx_PyInt_FromHash_t PyInt_FromLong
+  #define __Pyx_PyInt_AsHash_t   __Pyx_PyIndex_AsHash_t
+#else
+  #define __Pyx_PyInt_FromHash_t PyInt_FromSsize_t
+  #define __Pyx_PyInt_AsHash_t   __Pyx_PyIndex_AsSsize_t
+#endif
+#if PY_MAJOR_VERSION >= 3
+  #define __Pyx_PyMethod_New(func, self, klass) ((self) ? ((void)(klass), PyMethod_New(func, self)) : __Pyx_NewRef(func))
+#else
+  #define __Pyx_PyMethod_New(func, self, klass) PyMethod_New(func, self, klass)
+#endif
+#if CYTHON_USE_ASYNC_SLOTS
+  #if PY_VERSION_HEX >= 0x030500B1
+    #define __Pyx_PyAsyncMethodsStruct PyAsyncMethods
+    #define __Pyx_PyType_AsAsync(obj) (Py_TYPE(obj)->tp_as_async)
+  #else
+    #define __Pyx_PyType_AsAsync(obj) ((__Pyx_PyAsyncMethodsStruct*) (Py_TYPE(obj)->tp_reserved))
+  #endif
+#else
+  #define __Pyx_PyType_AsAsync(obj) NULL
+#endif
+#ifndef __Pyx_PyAsyncMethodsStruct
+    typedef struct {
+        unaryfunc am_await;
+        unaryfunc am_aiter;
+        unaryfunc am_anext;
+    } __Pyx_PyAsyncMethodsStruct;
+#endif
+
+#if defined(_WIN32) || defined(WIN32) || defined(MS_WINDOWS)
+  #if !defined(_USE_MATH_DEFINES)
+    #define _USE_MATH_DEFINES
+  #endif
+#endif
+#include <math.h>
+#ifdef NAN
+#define __PYX_NAN() ((float) NAN)
+#else
+static CYTHON_INLINE float __PYX_NAN() {
+  float value;
+  memset(&value, 0xFF, sizeof(value));
+  return value;
+}
+#endif
+#if defined(__CYGWIN__) && defined(_LDBL_EQ_DBL)
+#define __Pyx_truncl trunc
+#else
+#define __Pyx_truncl truncl
+#endif
+
+#define __PYX_MARK_ERR_POS(f_index, lineno) \
+    { __pyx_filename = __pyx_f[f_index]; (void)__pyx_filename; __pyx_lineno = lineno; (void)__pyx_lineno; __pyx_clineno = __LINE__; (void)__pyx_clineno; }
+#define __PYX_ERR(f_index, lineno, Ln_error) \
+    { __PYX_MARK_ERR_POS(f_index, lineno) goto Ln_error; }
+
+#ifndef __PYX_EXTERN_C
+  #ifdef __cplusplus
+    #define __PYX_EXTERN_C extern "C"
+  #else
+    #define __PYX_EXTERN_C extern
+  #endif
+#endif
+
+#define __PYX_HAVE__qmeq__approach__elph__c_redfield
+#define __PYX_HAVE_API__qmeq__approach__elph__c_redfield
+/* Early includes */
+#include <string.h>
+#include <stdio.h>
+#include "numpy/arrayobject.h"
+#include "numpy/ndarrayobject.h"
+#include "numpy/ndarraytypes.h"
+#include "numpy/arrayscalars.h"
+#include "numpy/ufuncobject.h"
+
+    /* NumPy API declarations from "numpy/__init__.pxd" */
+    
+#ifdef _OPENMP
+#include <omp.h>
+#endif /* _OPENMP */
+
+#if defined(PYREX_WITHOUT_ASSERTIONS) && !defined(CYTHON_WITHOUT_ASSERTIONS)
+#define CYTHON_WITHOUT_ASSERTIONS
+#endif
+
+typedef struct {PyObject **p; const char *s; const Py_ssize_t n; const char* encoding;
+                const char is_unicode; const char is_str; const char intern; } __Pyx_StringTabEntry;
+
+#define __PYX_DEFAULT_STRING_ENCODING_IS_ASCII 0
+#define __PYX_DEFAULT_STRING_ENCODING_IS_UTF8 0
+#define __PYX_DEFAULT_STRING_ENCODING_IS_DEFAULT (PY_MAJOR_VERSION >= 3 && __PYX_DEFAULT_STRING_ENCODING_IS_UTF8)
+#define __PYX_DEFAULT_STRING_ENCODING ""
+#define __Pyx_PyObject_FromString __Pyx_PyBytes_FromString
+#define __Pyx_PyObject_FromStringAndSize __Pyx_PyBytes_FromStringAndSize
+#define __Pyx_uchar_cast(c) ((unsigned char)c)
+#define __Pyx_long_cast(x) ((long)x)
+#define __Pyx_fits_Py_ssize_t(v, type, is_signed)  (\
+    (sizeof(type) < sizeof(Py_ssize_t))  ||\
+    (sizeof(type) > sizeof(Py_ssize_t) &&\
+          likely(v < (type)PY_SSIZE_T_MAX ||\
+                 v == (type)PY_SSIZE_T_MAX)  &&\
+          (!is_signed || likely(v > (type)PY_SSIZE_T_MIN ||\
+                                v == (type)PY_SSIZE_T_MIN)))  ||\
+    (sizeof(type) == sizeof(Py_ssize_t) &&\
+          (is_signed || likely(v < (type)PY_SSIZE_T_MAX ||\
+                               v == (type)PY_SSIZE_T_MAX)))  )
+static CYTHON_INLINE int __Pyx_is_valid_index(Py_ssize_t i, Py_ssize_t limit) {
+    return (size_t) i < (size_t) limit;
+}
+#if defined (__cplusplus) && __cplusplus >= 201103L
+    #include <cstdlib>
+    #define __Pyx_sst_abs(value) std::abs(value)
+#elif SIZEOF_INT >= SIZEOF_SIZE_T
+    #define __Pyx_sst_abs(value) abs(value)
+#elif SIZEOF_LONG >= SIZEOF_SIZE_T
+    #define __Pyx_sst_abs(value) labs(value)
+#elif defined (_MSC_VER)
+    #define __Pyx_sst_abs(value) ((Py_ssize_t)_abs64(value))
+#elif defined (__STDC_VERSION__) && __STDC_VERSION__ >= 199901L
+    #define __Pyx_sst_abs(value) llabs(value)
+#elif defined (__GNUC__)
+    #define __Pyx_sst_abs(value) __builtin_llabs(value)
+#else
+    #define __Pyx_sst_abs(value) ((value<0) ? -value : value)
+#endif
+static CYTHON_INLINE const char* __Pyx_PyObject_AsString(PyObject*);
+static CYTHON_INLINE const char* __Pyx_PyObject_AsStringAndSize(PyObject*, Py_ssize_t* length);
+#define __Pyx_PyByteArray_FromString(s) PyByteArray_FromStringAndSize((const char*)s, strlen((const char*)s))
+#define __Pyx_PyByteArray_FromStringAndSize(s, l) PyByteArray_FromStringAndSize((const char*)s, l)
+#define __Pyx_PyBytes_FromString        PyBytes_FromString
+#define __Pyx_PyBytes_FromStringAndSize PyBytes_FromStringAndSize
+static CYTHON_INLINE PyObject* __Pyx_PyUnicode_FromString(const char*);
+#if PY_MAJOR_VERSION < 3
+    #define __Pyx_PyStr_FromString        __Pyx_PyBytes_FromString
+    #define __Pyx_PyStr_FromStringAndSize __Pyx_PyBytes_FromStringAndSize
+#else
+    #define __Pyx_PyStr_FromString        __Pyx_PyUnicode_FromString
+    #define __Pyx_PyStr_FromStringAndSize __Pyx_PyUnicode_FromStringAndSize
+#endif
+#define __Pyx_PyBytes_AsWritableString(s)     ((char*) PyBytes_AS_STRING(s))
+#define __Pyx_PyBytes_AsWritableSString(s)    ((signed char*) PyBytes_AS_STRING(s))
+#define __Pyx_PyBytes_AsWritableUString(s)    ((unsigned char*) PyBytes_AS_STRING(s))
+#define __Pyx_PyBytes_AsString(s)     ((const char*) PyBytes_AS_STRING(s))
+#define __Pyx_PyBytes_AsSString(s)    ((const signed char*) PyBytes_AS_STRING(s))
+#define __Pyx_PyBytes_AsUString(s)    ((const unsigned char*) PyBytes_AS_STRING(s))
+#define __Pyx_PyObject_AsWritableString(s)    ((char*) __Pyx_PyObject_AsString(s))
+#define __Pyx_PyObject_AsWritableSString(s)    ((signed char*) __Pyx_PyObject_AsString(s))
+#define __Pyx_PyObject_AsWritableUString(s)    ((unsigned char*) __Pyx_PyObject_AsString(s))
+#define __Pyx_PyObject_AsSString(s)    ((const signed char*) __Pyx_PyObject_AsString(s))
+#define __Pyx_PyObject_AsUString(s)    ((const unsigned char*) __Pyx_PyObject_AsString(s))
+#define __Pyx_PyObject_FromCString(s)  __Pyx_PyObject_FromString((const char*)s)
+#define __Pyx_PyBytes_FromCString(s)   __Pyx_PyBytes_FromString((const char*)s)
+#define __Pyx_PyByteArray_FromCString(s)   __Pyx_PyByteArray_FromString((const char*)s)
+#define __Pyx_PyStr_FromCString(s)     __Pyx_PyStr_FromString((const char*)s)
+#define __Pyx_PyUnicode_FromCString(s) __Pyx_PyUnicode_FromString((const char*)s)
+static CYTHON_INLINE size_t __Pyx_Py_UNICODE_strlen(const Py_UNICODE *u) {
+    const Py_UNICODE *u_end = u;
+    while (*u_end++) ;
+    return (size_t)(u_end - u - 1);
+}
+#define __Pyx_PyUnicode_FromUnicode(u)       PyUnicode_FromUnicode(u, __Pyx_Py_UNICODE_strlen(u))
+#define __Pyx_PyUnicode_FromUnicodeAndLength PyUnicode_FromUnicode
+#define __Pyx_PyUnicode_AsUnicode            PyUnicode_AsUnicode
+#define __Pyx_NewRef(obj) (Py_INCREF(obj), obj)
+#define __Pyx_Owned_Py_None(b) __Pyx_NewRef(Py_None)
+static CYTHON_INLINE PyObject * __Pyx_PyBool_FromLong(long b);
+static CYTHON_INLINE int __Pyx_PyObject_IsTrue(PyObject*);
+static CYTHON_INLINE int __Pyx_PyObject_IsTrueAndDecref(PyObject*);
+static CYTHON_INLINE PyObject* __Pyx_PyNumber_IntOrLong(PyObject* x);
+#define __Pyx_PySequence_Tuple(obj)\
+    (likely(PyTuple_CheckExact(obj)) ? __Pyx_NewRef(obj) : PySequence_Tuple(obj))
+static CYTHON_INLINE Py_ssize_t __Pyx_PyIndex_AsSsize_t(PyObject*);
+static CYTHON_INLINE PyObject * __Pyx_PyInt_FromSize_t(size_t);
+static CYTHON_INLINE Py_hash_t __Pyx_PyIndex_AsHash_t(PyObject*);
+#if CYTHON_ASSUME_SAFE_MACROS
+#define __pyx_PyFloat_AsDouble(x) (PyFloat_CheckExact(x) ? PyFloat_AS_DOUBLE(x) : PyFloat_AsDouble(x))
+#else
+#define __pyx_PyFloat_AsDouble(x) PyFloat_AsDouble(x)
+#endif
+#define __pyx_PyFloat_AsFloat(x) ((float) __pyx_PyFloat_AsDouble(x))
+#if PY_MAJOR_VERSION >= 3
+#define __Pyx_PyNumber_Int(x) (PyLong_CheckExact(x) ? __Pyx_NewRef(x) : PyNumber_Long(x))
+#else
+#define __Pyx_PyNumber_Int(x) (PyInt_CheckExact(x) ? __Pyx_NewRef(x) : PyNumber_Int(x))
+#endif
+#define __Pyx_PyNumber_Float(x) (PyFloat_CheckExact(x) ? __Pyx_NewRef(x) : PyNumber_Float(x))
+#if PY_MAJOR_VERSION < 3 && __PYX_DEFAULT_STRING_ENCODING_IS_ASCII
+static int __Pyx_sys_getdefaultencoding_not_ascii;
+static int __Pyx_init_sys_getdefaultencoding_params(void) {
+    PyObject* sys;
+    PyObject* default_encoding = NULL;
+    PyObject* ascii_chars_u = NULL;
+    PyObject* ascii_chars_b = NULL;
+    const char* default_encoding_c;
+    sys = PyImport_ImportModule("sys");
+    if (!sys) goto bad;
+    default_encoding = PyObject_CallMethod(sys, (char*) "getdefaultencoding", NULL);
+    Py_DECREF(sys);
+    if (!default_encoding) goto bad;
+    default_encoding_c = PyBytes_AsString(default_encoding);
+    if (!default_encoding_c) goto bad;
+    if (strcmp(default_encoding_c, "ascii") == 0) {
+        __Pyx_sys_getdefaultencoding_not_ascii = 0;
+    } else {
+        char ascii_chars[128];
+        int c;
+        for (c = 0; c < 128; c++) {
+            ascii_chars[c] = c;
+        }
+        __Pyx_sys_getdefaultencoding_not_ascii = 1;
+        ascii_chars_u = PyUnicode_DecodeASCII(ascii_chars, 128, NULL);
+        if (!ascii_chars_u) goto bad;
+        ascii_chars_b = PyUnicode_AsEncodedString(ascii_chars_u, default_encoding_c, NULL);
+        if (!ascii_chars_b || !PyBytes_Check(ascii_chars_b) || memcmp(ascii_chars, PyBytes_AS_STRING(ascii_chars_b), 128) != 0) {
+            PyErr_Format(
+                PyExc_ValueError,
+                "This module compiled with c_string_encoding=ascii, but default encoding '%.200s' is not a superset of ascii.",
+                default_encoding_c);
+            goto bad;
+        }
+        Py_DECREF(ascii_chars_u);
+        Py_DECREF(ascii_chars_b);
+    }
+    Py_DECREF(default_encoding);
+    return 0;
+bad:
+    Py_XDECREF(default_encoding);
+    Py_XDECREF(ascii_chars_u);
+    Py_XDECREF(ascii_chars_b);
+    return -1;
+}
+#endif
+#if __PYX_DEFAULT_STRING_ENCODING_IS_DEFAULT && PY_MAJOR_VERSION >= 3
+#define __Pyx_PyUnicode_FromStringAndSize(c_str, size) PyUnicode_DecodeUTF8(c_str, size, NULL)
+#else
+#define __Pyx_PyUnicode_FromStringAndSize(c_str, size) PyUnicode_Decode(c_str, size, __PYX_DEFAULT_STRING_ENCODING, NULL)
+#if __PYX_DEFAULT_STRING_ENCODING_IS_DEFAULT
+static char* __PYX_DEFAULT_STRING_ENCODING;
+static int __Pyx_init_sys_getdefaultencoding_params(void) {
+    PyObject* sys;
+    PyObject* default_encoding = NULL;
+    char* default_encoding_c;
+    sys = PyImport_ImportModule("sys");
+    if (!sys) goto bad;
+    default_encoding = PyObject_CallMethod(sys, (char*) (const char*) "getdefaultencoding", NULL);
+    Py_DECREF(sys);
+    if (!default_encoding) goto bad;
+    default_encoding_c = PyBytes_AsString(default_encoding);
+    if (!default_encoding_c) goto bad;
+    __PYX_DEFAULT_STRING_ENCODING = (char*) malloc(strlen(default_encoding_c) + 1);
+    if (!__PYX_DEFAULT_STRING_ENCODING) goto bad;
+    strcpy(__PYX_DEFAULT_STRING_ENCODING, default_encoding_c);
+    Py_DECREF(default_encoding);
+    return 0;
+bad:
+    Py_XDECREF(default_encoding);
+    return -1;
+}
+#endif
+#endif
+
+
+/* Test for GCC > 2.95 */
+#if defined(__GNUC__)     && (__GNUC__ > 2 || (__GNUC__ == 2 && (__GNUC_MINOR__ > 95)))
+  #define likely(x)   __builtin_expect(!!(x), 1)
+  #define unlikely(x) __builtin_expect(!!(x), 0)
+#else /* !__GNUC__ or GCC < 2.95 */
+  #define likely(x)   (x)
+  #define unlikely(x) (x)
+#endif /* __GNUC__ */
+static CYTHON_INLINE void __Pyx_pretend_to_initialize(void* ptr) { (void)ptr; }
+
+static PyObject *__pyx_m = NULL;
+static PyObject *__pyx_d;
+static PyObject *__pyx_b;
+static PyObject *__pyx_cython_runtime = NULL;
+static PyObject *__pyx_empty_tuple;
+static PyObject *__pyx_empty_bytes;
+static PyObject *__pyx_empty_unicode;
+static int __pyx_lineno;
+static int __pyx_clineno = 0;
+static const char * __pyx_cfilenm= __FILE__;
+static const char *__pyx_filename;
+
+/* Header.proto */
+#if !defined(CYTHON_CCOMPLEX)
+  #if defined(__cplusplus)
+    #define CYTHON_CCOMPLEX 1
+  #elif (defined(_Complex_I) && !defined(_MSC_VER))
+    #define CYTHON_CCOMPLEX 1
+  #else
+    #define CYTHON_CCOMPLEX 0
+  #endif
+#endif
+#if CYTHON_CCOMPLEX
+  #ifdef __cplusplus
+    #include <complex>
+  #else
+    #include <complex.h>
+  #endif
+#endif
+#if CYTHON_CCOMPLEX && !defined(__cplusplus) && defined(__sun__) && defined(__GNUC__)
+  #undef _Complex_I
+  #define _Complex_I 1.0fj
+#endif
+
+
+static const char *__pyx_f[] = {
+  "qmeq/approach/elph/c_redfield.pyx",
+  "__init__.pxd",
+  "type.pxd",
+};
+/* BufferFormatStructs.proto */
+#define IS_UNSIGNED(type) (((type) -1) > 0)
+struct __Pyx_StructField_;
+#define __PYX_BUF_FLAGS_PACKED_STRUCT (1 << 0)
+typedef struct {
+  const char* name;
+  struct __Pyx_StructField_* fields;
+  size_t size;
+  size_t arraysize[8];
+  int ndim;
+  char typegroup;
+  char is_unsigned;
+  int flags;
+} __Pyx_TypeInfo;
+typedef struct __Pyx_StructField_ {
+  __Pyx_TypeInfo* type;
+  const char* name;
+  size_t offset;
+} __Pyx_StructField;
+typedef struct {
+  __Pyx_StructField* field;
+  size_t parent_offset;
+} __Pyx_BufFmt_StackElem;
+typedef struct {
+  __Pyx_StructField root;
+  __Pyx_BufFmt_StackElem* head;
+  size_t fmt_offset;
+  size_t new_count, enc_count;
+  size_t struct_alignment;
+  int is_complex;
+  char enc_type;
+  char new_packmode;
+  char enc_packmode;
+  char is_valid_array;
+} __Pyx_BufFmt_Context;
+
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":689
+ * # in Cython to enable them only on the right systems.
+ * 
+ * ctypedef npy_int8       int8_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_int16      int16_t
+ * ctypedef npy_int32      int32_t
+ */
+typedef npy_int8 __pyx_t_5numpy_int8_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":690
+ * 
+ * ctypedef npy_int8       int8_t
+ * ctypedef npy_int16      int16_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_int32      int32_t
+ * ctypedef npy_int64      int64_t
+ */
+typedef npy_int16 __pyx_t_5numpy_int16_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":691
+ * ctypedef npy_int8       int8_t
+ * ctypedef npy_int16      int16_t
+ * ctypedef npy_int32      int32_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_int64      int64_t
+ * #ctypedef npy_int96      int96_t
+ */
+typedef npy_int32 __pyx_t_5numpy_int32_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":692
+ * ctypedef npy_int16      int16_t
+ * ctypedef npy_int32      int32_t
+ * ctypedef npy_int64      int64_t             # <<<<<<<<<<<<<<
+ * #ctypedef npy_int96      int96_t
+ * #ctypedef npy_int128     int128_t
+ */
+typedef npy_int64 __pyx_t_5numpy_int64_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":696
+ * #ctypedef npy_int128     int128_t
+ * 
+ * ctypedef npy_uint8      uint8_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_uint16     uint16_t
+ * ctypedef npy_uint32     uint32_t
+ */
+typedef npy_uint8 __pyx_t_5numpy_uint8_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":697
+ * 
+ * ctypedef npy_uint8      uint8_t
+ * ctypedef npy_uint16     uint16_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_uint32     uint32_t
+ * ctypedef npy_uint64     uint64_t
+ */
+typedef npy_uint16 __pyx_t_5numpy_uint16_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":698
+ * ctypedef npy_uint8      uint8_t
+ * ctypedef npy_uint16     uint16_t
+ * ctypedef npy_uint32     uint32_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_uint64     uint64_t
+ * #ctypedef npy_uint96     uint96_t
+ */
+typedef npy_uint32 __pyx_t_5numpy_uint32_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":699
+ * ctypedef npy_uint16     uint16_t
+ * ctypedef npy_uint32     uint32_t
+ * ctypedef npy_uint64     uint64_t             # <<<<<<<<<<<<<<
+ * #ctypedef npy_uint96     uint96_t
+ * #ctypedef npy_uint128    uint128_t
+ */
+typedef npy_uint64 __pyx_t_5numpy_uint64_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":703
+ * #ctypedef npy_uint128    uint128_t
+ * 
+ * ctypedef npy_float32    float32_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_float64    float64_t
+ * #ctypedef npy_float80    float80_t
+ */
+typedef npy_float32 __pyx_t_5numpy_float32_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":704
+ * 
+ * ctypedef npy_float32    float32_t
+ * ctypedef npy_float64    float64_t             # <<<<<<<<<<<<<<
+ * #ctypedef npy_float80    float80_t
+ * #ctypedef npy_float128   float128_t
+ */
+typedef npy_float64 __pyx_t_5numpy_float64_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":713
+ * # The int types are mapped a bit surprising --
+ * # numpy.int corresponds to 'l' and numpy.long to 'q'
+ * ctypedef npy_long       int_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_longlong   long_t
+ * ctypedef npy_longlong   longlong_t
+ */
+typedef npy_long __pyx_t_5numpy_int_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":714
+ * # numpy.int corresponds to 'l' and numpy.long to 'q'
+ * ctypedef npy_long       int_t
+ * ctypedef npy_longlong   long_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_longlong   longlong_t
+ * 
+ */
+typedef npy_longlong __pyx_t_5numpy_long_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":715
+ * ctypedef npy_long       int_t
+ * ctypedef npy_longlong   long_t
+ * ctypedef npy_longlong   longlong_t             # <<<<<<<<<<<<<<
+ * 
+ * ctypedef npy_ulong      uint_t
+ */
+typedef npy_longlong __pyx_t_5numpy_longlong_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":717
+ * ctypedef npy_longlong   longlong_t
+ * 
+ * ctypedef npy_ulong      uint_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_ulonglong  ulong_t
+ * ctypedef npy_ulonglong  ulonglong_t
+ */
+typedef npy_ulong __pyx_t_5numpy_uint_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":718
+ * 
+ * ctypedef npy_ulong      uint_t
+ * ctypedef npy_ulonglong  ulong_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_ulonglong  ulonglong_t
+ * 
+ */
+typedef npy_ulonglong __pyx_t_5numpy_ulong_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":719
+ * ctypedef npy_ulong      uint_t
+ * ctypedef npy_ulonglong  ulong_t
+ * ctypedef npy_ulonglong  ulonglong_t             # <<<<<<<<<<<<<<
+ * 
+ * ctypedef npy_intp       intp_t
+ */
+typedef npy_ulonglong __pyx_t_5numpy_ulonglong_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":721
+ * ctypedef npy_ulonglong  ulonglong_t
+ * 
+ * ctypedef npy_intp       intp_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_uintp      uintp_t
+ * 
+ */
+typedef npy_intp __pyx_t_5numpy_intp_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":722
+ * 
+ * ctypedef npy_intp       intp_t
+ * ctypedef npy_uintp      uintp_t             # <<<<<<<<<<<<<<
+ * 
+ * ctypedef npy_double     float_t
+ */
+typedef npy_uintp __pyx_t_5numpy_uintp_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":724
+ * ctypedef npy_uintp      uintp_t
+ * 
+ * ctypedef npy_double     float_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_double     double_t
+ * ctypedef npy_longdouble longdouble_t
+ */
+typedef npy_double __pyx_t_5numpy_float_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":725
+ * 
+ * ctypedef npy_double     float_t
+ * ctypedef npy_double     double_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_longdouble longdouble_t
+ * 
+ */
+typedef npy_double __pyx_t_5numpy_double_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":726
+ * ctypedef npy_double     float_t
+ * ctypedef npy_double     double_t
+ * ctypedef npy_longdouble longdouble_t             # <<<<<<<<<<<<<<
+ * 
+ * ctypedef npy_cfloat      cfloat_t
+ */
+typedef npy_longdouble __pyx_t_5numpy_longdouble_t;
+
+/* "qmeq/approach/elph/c_redfield.pyx":25
+ * cimport cython
+ * 
+ * ctypedef np.uint8_t bool_t             # <<<<<<<<<<<<<<
+ * ctypedef np.int_t int_t
+ * ctypedef np.int64_t long_t
+ */
+typedef __pyx_t_5numpy_uint8_t __pyx_t_4qmeq_8approach_4elph_10c_redfield_bool_t;
+
+/* "qmeq/approach/elph/c_redfield.pyx":26
+ * 
+ * ctypedef np.uint8_t bool_t
+ * ctypedef np.int_t int_t             # <<<<<<<<<<<<<<
+ * ctypedef np.int64_t long_t
+ * ctypedef np.float64_t double_t
+ */
+typedef __pyx_t_5numpy_int_t __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t;
+
+/* "qmeq/approach/elph/c_redfield.pyx":27
+ * ctypedef np.uint8_t bool_t
+ * ctypedef np.int_t int_t
+ * ctypedef np.int64_t long_t             # <<<<<<<<<<<<<<
+ * ctypedef np.float64_t double_t
+ * ctypedef np.complex128_t complex_t
+ */
+typedef __pyx_t_5numpy_int64_t __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t;
+
+/* "qmeq/approach/elph/c_redfield.pyx":28
+ * ctypedef np.int_t int_t
+ * ctypedef np.int64_t long_t
+ * ctypedef np.float64_t double_t             # <<<<<<<<<<<<<<
+ * ctypedef np.complex128_t complex_t
+ * 
+ */
+typedef __pyx_t_5numpy_float64_t __pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t;
+/* Declarations.proto */
+#if CYTHON_CCOMPLEX
+  #ifdef __cplusplus
+    typedef ::std::complex< double > __pyx_t_double_complex;
+  #else
+    typedef double _Complex __pyx_t_double_complex;
+  #endif
+#else
+    typedef struct { double real, imag; } __pyx_t_double_complex;
+#endif
+static CYTHON_INLINE __pyx_t_double_complex __pyx_t_double_complex_from_parts(double, double);
+
+/* Declarations.proto */
+#if CYTHON_CCOMPLEX
+  #ifdef __cplusplus
+    typedef ::std::complex< float > __pyx_t_float_complex;
+  #else
+    typedef float _Complex __pyx_t_float_complex;
+  #endif
+#else
+    typedef struct { float real, imag; } __pyx_t_float_complex;
+#endif
+static CYTHON_INLINE __pyx_t_float_complex __pyx_t_float_complex_from_parts(float, float);
+
+
+/*--- Type declarations ---*/
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":728
+ * ctypedef npy_longdouble longdouble_t
+ * 
+ * ctypedef npy_cfloat      cfloat_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_cdouble     cdouble_t
+ * ctypedef npy_clongdouble clongdouble_t
+ */
+typedef npy_cfloat __pyx_t_5numpy_cfloat_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":729
+ * 
+ * ctypedef npy_cfloat      cfloat_t
+ * ctypedef npy_cdouble     cdouble_t             # <<<<<<<<<<<<<<
+ * ctypedef npy_clongdouble clongdouble_t
+ * 
+ */
+typedef npy_cdouble __pyx_t_5numpy_cdouble_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":730
+ * ctypedef npy_cfloat      cfloat_t
+ * ctypedef npy_cdouble     cdouble_t
+ * ctypedef npy_clongdouble clongdouble_t             # <<<<<<<<<<<<<<
+ * 
+ * ctypedef npy_cdouble     complex_t
+ */
+typedef npy_clongdouble __pyx_t_5numpy_clongdouble_t;
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":732
+ * ctypedef npy_clongdouble clongdouble_t
+ * 
+ * ctypedef npy_cdouble     complex_t             # <<<<<<<<<<<<<<
+ * 
+ * cdef inline object PyArray_MultiIterNew1(a):
+ */
+typedef npy_cdouble __pyx_t_5numpy_complex_t;
+
+/* --- Runtime support code (head) --- */
+/* Refnanny.proto */
+#ifndef CYTHON_REFNANNY
+  #define CYTHON_REFNANNY 0
+#endif
+#if CYTHON_REFNANNY
+  typedef struct {
+    void (*INCREF)(void*, PyObject*, int);
+    void (*DECREF)(void*, PyObject*, int);
+    void (*GOTREF)(void*, PyObject*, int);
+    void (*GIVEREF)(void*, PyObject*, int);
+    void* (*SetupContext)(const char*, int, const char*);
+    void (*FinishContext)(void**);
+  } __Pyx_RefNannyAPIStruct;
+  static __Pyx_RefNannyAPIStruct *__Pyx_RefNanny = NULL;
+  static __Pyx_RefNannyAPIStruct *__Pyx_RefNannyImportAPI(const char *modname);
+  #define __Pyx_RefNannyDeclarations void *__pyx_refnanny = NULL;
+#ifdef WITH_THREAD
+  #define __Pyx_RefNannySetupContext(name, acquire_gil)\
+          if (acquire_gil) {\
+              PyGILState_STATE __pyx_gilstate_save = PyGILState_Ensure();\
+              __pyx_refnanny = __Pyx_RefNanny->SetupContext((name), __LINE__, __FILE__);\
+              PyGILState_Release(__pyx_gilstate_save);\
+          } else {\
+              __pyx_refnanny = __Pyx_RefNanny->SetupContext((name), __LINE__, __FILE__);\
+          }
+#else
+  #define __Pyx_RefNannySetupContext(name, acquire_gil)\
+          __pyx_refnanny = __Pyx_RefNanny->SetupContext((name), __LINE__, __FILE__)
+#endif
+  #define __Pyx_RefNannyFinishContext()\
+          __Pyx_RefNanny->FinishContext(&__pyx_refnanny)
+  #define __Pyx_INCREF(r)  __Pyx_RefNanny->INCREF(__pyx_refnanny, (PyObject *)(r), __LINE__)
+  #define __Pyx_DECREF(r)  __Pyx_RefNanny->DECREF(__pyx_refnanny, (PyObject *)(r), __LINE__)
+  #define __Pyx_GOTREF(r)  __Pyx_RefNanny->GOTREF(__pyx_refnanny, (PyObject *)(r), __LINE__)
+  #define __Pyx_GIVEREF(r) __Pyx_RefNanny->GIVEREF(__pyx_refnanny, (PyObject *)(r), __LINE__)
+  #define __Pyx_XINCREF(r)  do { if((r) != NULL) {__Pyx_INCREF(r); }} while(0)
+  #define __Pyx_XDECREF(r)  do { if((r) != NULL) {__Pyx_DECREF(r); }} while(0)
+  #define __Pyx_XGOTREF(r)  do { if((r) != NULL) {__Pyx_GOTREF(r); }} while(0)
+  #define __Pyx_XGIVEREF(r) do { if((r) != NULL) {__Pyx_GIVEREF(r);}} while(0)
+#else
+  #define __Pyx_RefNannyDeclarations
+  #define __Pyx_RefNannySetupContext(name, acquire_gil)
+  #define __Pyx_RefNannyFinishContext()
+  #define __Pyx_INCREF(r) Py_INCREF(r)
+  #define __Pyx_DECREF(r) Py_DECREF(r)
+  #define __Pyx_GOTREF(r)
+  #define __Pyx_GIVEREF(r)
+  #define __Pyx_XINCREF(r) Py_XINCREF(r)
+  #define __Pyx_XDECREF(r) Py_XDECREF(r)
+  #define __Pyx_XGOTREF(r)
+  #define __Pyx_XGIVEREF(r)
+#endif
+#define __Pyx_XDECREF_SET(r, v) do {\
+        PyObject *tmp = (PyObject *) r;\
+        r = v; __Pyx_XDECREF(tmp);\
+    } while (0)
+#define __Pyx_DECREF_SET(r, v) do {\
+        PyObject *tmp = (PyObject *) r;\
+        r = v; __Pyx_DECREF(tmp);\
+    } while (0)
+#define __Pyx_CLEAR(r)    do { PyObject* tmp = ((PyObject*)(r)); r = NULL; __Pyx_DECREF(tmp);} while(0)
+#define __Pyx_XCLEAR(r)   do { if((r) != NULL) {PyObject* tmp = ((PyObject*)(r)); r = NULL; __Pyx_DECREF(tmp);}} while(0)
+
+/* PyObjectGetAttrStr.proto */
+#if CYTHON_USE_TYPE_SLOTS
+static CYTHON_INLINE PyObject* __Pyx_PyObject_GetAttrStr(PyObject* obj, PyObject* attr_name);
+#else
+#define __Pyx_PyObject_GetAttrStr(o,n) PyObject_GetAttr(o,n)
+#endif
+
+/* GetBuiltinName.proto */
+static PyObject *__Pyx_GetBuiltinName(PyObject *name);
+
+/* ExtTypeTest.proto */
+static CYTHON_INLINE int __Pyx_TypeTest(PyObject *obj, PyTypeObject *type);
+
+/* IsLittleEndian.proto */
+static CYTHON_INLINE int __Pyx_Is_Little_Endian(void);
+
+/* BufferFormatCheck.proto */
+static const char* __Pyx_BufFmt_CheckString(__Pyx_BufFmt_Context* ctx, const char* ts);
+static void __Pyx_BufFmt_Init(__Pyx_BufFmt_Context* ctx,
+                              __Pyx_BufFmt_StackElem* stack,
+                              __Pyx_TypeInfo* type);
+
+/* BufferGetAndValidate.proto */
+#define __Pyx_GetBufferAndValidate(buf, obj, dtype, flags, nd, cast, stack)\
+    ((obj == Py_None || obj == NULL) ?\
+    (__Pyx_ZeroBuffer(buf), 0) :\
+    __Pyx__GetBufferAndValidate(buf, obj, dtype, flags, nd, cast, stack))
+static int  __Pyx__GetBufferAndValidate(Py_buffer* buf, PyObject* obj,
+    __Pyx_TypeInfo* dtype, int flags, int nd, int cast, __Pyx_BufFmt_StackElem* stack);
+static void __Pyx_ZeroBuffer(Py_buffer* buf);
+static CYTHON_INLINE void __Pyx_SafeReleaseBuffer(Py_buffer* info);
+static Py_ssize_t __Pyx_minusones[] = { -1, -1, -1, -1, -1, -1, -1, -1 };
+static Py_ssize_t __Pyx_zeros[] = { 0, 0, 0, 0, 0, 0, 0, 0 };
+
+/* PyDictVersioning.proto */
+#if CYTHON_USE_DICT_VERSIONS && CYTHON_USE_TYPE_SLOTS
+#define __PYX_DICT_VERSION_INIT  ((PY_UINT64_T) -1)
+#define __PYX_GET_DICT_VERSION(dict)  (((PyDictObject*)(dict))->ma_version_tag)
+#define __PYX_UPDATE_DICT_CACHE(dict, value, cache_var, version_var)\
+    (version_var) = __PYX_GET_DICT_VERSION(dict);\
+    (cache_var) = (value);
+#define __PYX_PY_DICT_LOOKUP_IF_MODIFIED(VAR, DICT, LOOKUP) {\
+    static PY_UINT64_T __pyx_dict_version = 0;\
+    static PyObject *__pyx_dict_cached_value = NULL;\
+    if (likely(__PYX_GET_DICT_VERSION(DICT) == __pyx_dict_version)) {\
+        (VAR) = __pyx_dict_cached_value;\
+    } else {\
+        (VAR) = __pyx_dict_cached_value = (LOOKUP);\
+        __pyx_dict_version = __PYX_GET_DICT_VERSION(DICT);\
+    }\
+}
+static CYTHON_INLINE PY_UINT64_T __Pyx_get_tp_dict_version(PyObject *obj);
+static CYTHON_INLINE PY_UINT64_T __Pyx_get_object_dict_version(PyObject *obj);
+static CYTHON_INLINE int __Pyx_object_dict_version_matches(PyObject* obj, PY_UINT64_T tp_dict_version, PY_UINT64_T obj_dict_version);
+#else
+#define __PYX_GET_DICT_VERSION(dict)  (0)
+#define __PYX_UPDATE_DICT_CACHE(dict, value, cache_var, version_var)
+#define __PYX_PY_DICT_LOOKUP_IF_MODIFIED(VAR, DICT, LOOKUP)  (VAR) = (LOOKUP);
+#endif
+
+/* GetModuleGlobalName.proto */
+#if CYTHON_USE_DICT_VERSIONS
+#define __Pyx_GetModuleGlobalName(var, name)  do {\
+    static PY_UINT64_T __pyx_dict_version = 0;\
+    static PyObject *__pyx_dict_cached_value = NULL;\
+    (var) = (likely(__pyx_dict_version == __PYX_GET_DICT_VERSION(__pyx_d))) ?\
+        (likely(__pyx_dict_cached_value) ? __Pyx_NewRef(__pyx_dict_cached_value) : __Pyx_GetBuiltinName(name)) :\
+        __Pyx__GetModuleGlobalName(name, &__pyx_dict_version, &__pyx_dict_cached_value);\
+} while(0)
+#define __Pyx_GetModuleGlobalNameUncached(var, name)  do {\
+    PY_UINT64_T __pyx_dict_version;\
+    PyObject *__pyx_dict_cached_value;\
+    (var) = __Pyx__GetModuleGlobalName(name, &__pyx_dict_version, &__pyx_dict_cached_value);\
+} while(0)
+static PyObject *__Pyx__GetModuleGlobalName(PyObject *name, PY_UINT64_T *dict_version, PyObject **dict_cached_value);
+#else
+#define __Pyx_GetModuleGlobalName(var, name)  (var) = __Pyx__GetModuleGlobalName(name)
+#define __Pyx_GetModuleGlobalNameUncached(var, name)  (var) = __Pyx__GetModuleGlobalName(name)
+static CYTHON_INLINE PyObject *__Pyx__GetModuleGlobalName(PyObject *name);
+#endif
+
+/* PyObjectCall.proto */
+#if CYTHON_COMPILING_IN_CPYTHON
+static CYTHON_INLINE PyObject* __Pyx_PyObject_Call(PyObject *func, PyObject *arg, PyObject *kw);
+#else
+#define __Pyx_PyObject_Call(func, arg, kw) PyObject_Call(func, arg, kw)
+#endif
+
+/* PyObjectSetAttrStr.proto */
+#if CYTHON_USE_TYPE_SLOTS
+#define __Pyx_PyObject_DelAttrStr(o,n) __Pyx_PyObject_SetAttrStr(o, n, NULL)
+static CYTHON_INLINE int __Pyx_PyObject_SetAttrStr(PyObject* obj, PyObject* attr_name, PyObject* value);
+#else
+#define __Pyx_PyObject_DelAttrStr(o,n)   PyObject_DelAttr(o,n)
+#define __Pyx_PyObject_SetAttrStr(o,n,v) PyObject_SetAttr(o,n,v)
+#endif
+
+/* GetItemInt.proto */
+#define __Pyx_GetItemInt(o, i, type, is_signed, to_py_func, is_list, wraparound, boundscheck)\
+    (__Pyx_fits_Py_ssize_t(i, type, is_signed) ?\
+    __Pyx_GetItemInt_Fast(o, (Py_ssize_t)i, is_list, wraparound, boundscheck) :\
+    (is_list ? (PyErr_SetString(PyExc_IndexError, "list index out of range"), (PyObject*)NULL) :\
+               __Pyx_GetItemInt_Generic(o, to_py_func(i))))
+#define __Pyx_GetItemInt_List(o, i, type, is_signed, to_py_func, is_list, wraparound, boundscheck)\
+    (__Pyx_fits_Py_ssize_t(i, type, is_signed) ?\
+    __Pyx_GetItemInt_List_Fast(o, (Py_ssize_t)i, wraparound, boundscheck) :\
+    (PyErr_SetString(PyExc_IndexError, "list index out of range"), (PyObject*)NULL))
+static CYTHON_INLINE PyObject *__Pyx_GetItemInt_List_Fast(PyObject *o, Py_ssize_t i,
+                                                              int wraparound, int boundscheck);
+#define __Pyx_GetItemInt_Tuple(o, i, type, is_signed, to_py_func, is_list, wraparound, boundscheck)\
+    (__Pyx_fits_Py_ssize_t(i, type, is_signed) ?\
+    __Pyx_GetItemInt_Tuple_Fast(o, (Py_ssize_t)i, wraparound, boundscheck) :\
+    (PyErr_SetString(PyExc_IndexError, "tuple index out of range"), (PyObject*)NULL))
+static CYTHON_INLINE PyObject *__Pyx_GetItemInt_Tuple_Fast(PyObject *o, Py_ssize_t i,
+                                                              int wraparound, int boundscheck);
+static PyObject *__Pyx_GetItemInt_Generic(PyObject *o, PyObject* j);
+static CYTHON_INLINE PyObject *__Pyx_GetItemInt_Fast(PyObject *o, Py_ssize_t i,
+                                                     int is_list, int wraparound, int boundscheck);
+
+/* ObjectGetItem.proto */
+#if CYTHON_USE_TYPE_SLOTS
+static CYTHON_INLINE PyObject *__Pyx_PyObject_GetItem(PyObject *obj, PyObject* key);
+#else
+#define __Pyx_PyObject_GetItem(obj, key)  PyObject_GetItem(obj, key)
+#endif
+
+/* PyFunctionFastCall.proto */
+#if CYTHON_FAST_PYCALL
+#define __Pyx_PyFunction_FastCall(func, args, nargs)\
+    __Pyx_PyFunction_FastCallDict((func), (args), (nargs), NULL)
+#if 1 || PY_VERSION_HEX < 0x030600B1
+static PyObject *__Pyx_PyFunction_FastCallDict(PyObject *func, PyObject **args, Py_ssize_t nargs, PyObject *kwargs);
+#else
+#define __Pyx_PyFunction_FastCallDict(func, args, nargs, kwargs) _PyFunction_FastCallDict(func, args, nargs, kwargs)
+#endif
+#define __Pyx_BUILD_ASSERT_EXPR(cond)\
+    (sizeof(char [1 - 2*!(cond)]) - 1)
+#ifndef Py_MEMBER_SIZE
+#define Py_MEMBER_SIZE(type, member) sizeof(((type *)0)->member)
+#endif
+#if CYTHON_FAST_PYCALL
+  static size_t __pyx_pyframe_localsplus_offset = 0;
+  #include "frameobject.h"
+#if PY_VERSION_HEX >= 0x030b00a6
+  #ifndef Py_BUILD_CORE
+    #define Py_BUILD_CORE 1
+  #endif
+  #include "internal/pycore_frame.h"
+#endif
+  #define __Pxy_PyFrame_Initialize_Offsets()\
+    ((void)__Pyx_BUILD_ASSERT_EXPR(sizeof(PyFrameObject) == offsetof(PyFrameObject, f_localsplus) + Py_MEMBER_SIZE(PyFrameObject, f_localsplus)),\
+     (void)(__pyx_pyframe_localsplus_offset = ((size_t)PyFrame_Type.tp_basicsize) - Py_MEMBER_SIZE(PyFrameObject, f_localsplus)))
+  #define __Pyx_PyFrame_GetLocalsplus(frame)\
+    (assert(__pyx_pyframe_localsplus_offset), (PyObject **)(((char *)(frame)) + __pyx_pyframe_localsplus_offset))
+#endif // CYTHON_FAST_PYCALL
+#endif
+
+/* PyCFunctionFastCall.proto */
+#if CYTHON_FAST_PYCCALL
+static CYTHON_INLINE PyObject *__Pyx_PyCFunction_FastCall(PyObject *func, PyObject **args, Py_ssize_t nargs);
+#else
+#define __Pyx_PyCFunction_FastCall(func, args, nargs)  (assert(0), NULL)
+#endif
+
+/* RaiseTooManyValuesToUnpack.proto */
+static CYTHON_INLINE void __Pyx_RaiseTooManyValuesError(Py_ssize_t expected);
+
+/* RaiseNeedMoreValuesToUnpack.proto */
+static CYTHON_INLINE void __Pyx_RaiseNeedMoreValuesError(Py_ssize_t index);
+
+/* IterFinish.proto */
+static CYTHON_INLINE int __Pyx_IterFinish(void);
+
+/* UnpackItemEndCheck.proto */
+static int __Pyx_IternextUnpackEndCheck(PyObject *retval, Py_ssize_t expected);
+
+#define __Pyx_BufPtrStrided1d(type, buf, i0, s0) (type)((char*)buf + i0 * s0)
+#define __Pyx_BufPtrStrided3d(type, buf, i0, s0, i1, s1, i2, s2) (type)((char*)buf + i0 * s0 + i1 * s1 + i2 * s2)
+#define __Pyx_BufPtrStrided2d(type, buf, i0, s0, i1, s1) (type)((char*)buf + i0 * s0 + i1 * s1)
+/* PyThreadStateGet.proto */
+#if CYTHON_FAST_THREAD_STATE
+#define __Pyx_PyThreadState_declare  PyThreadState *__pyx_tstate;
+#define __Pyx_PyThreadState_assign  __pyx_tstate = __Pyx_PyThreadState_Current;
+#define __Pyx_PyErr_Occurred()  __pyx_tstate->curexc_type
+#else
+#define __Pyx_PyThreadState_declare
+#define __Pyx_PyThreadState_assign
+#define __Pyx_PyErr_Occurred()  PyErr_Occurred()
+#endif
+
+/* PyErrFetchRestore.proto */
+#if CYTHON_FAST_THREAD_STATE
+#define __Pyx_PyErr_Clear() __Pyx_ErrRestore(NULL, NULL, NULL)
+#define __Pyx_ErrRestoreWithState(type, value, tb)  __Pyx_ErrRestoreInState(PyThreadState_GET(), type, value, tb)
+#define __Pyx_ErrFetchWithState(type, value, tb)    __Pyx_ErrFetchInState(PyThreadState_GET(), type, value, tb)
+#define __Pyx_ErrRestore(type, value, tb)  __Pyx_ErrRestoreInState(__pyx_tstate, type, value, tb)
+#define __Pyx_ErrFetch(type, value, tb)    __Pyx_ErrFetchInState(__pyx_tstate, type, value, tb)
+static CYTHON_INLINE void __Pyx_ErrRestoreInState(PyThreadState *tstate, PyObject *type, PyObject *value, PyObject *tb);
+static CYTHON_INLINE void __Pyx_ErrFetchInState(PyThreadState *tstate, PyObject **type, PyObject **value, PyObject **tb);
+#if CYTHON_COMPILING_IN_CPYTHON
+#define __Pyx_PyErr_SetNone(exc) (Py_INCREF(exc), __Pyx_ErrRestore((exc), NULL, NULL))
+#else
+#define __Pyx_PyErr_SetNone(exc) PyErr_SetNone(exc)
+#endif
+#else
+#define __Pyx_PyErr_Clear() PyErr_Clear()
+#define __Pyx_PyErr_SetNone(exc) PyErr_SetNone(exc)
+#define __Pyx_ErrRestoreWithState(type, value, tb)  PyErr_Restore(type, value, tb)
+#define __Pyx_ErrFetchWithState(type, value, tb)  PyErr_Fetch(type, value, tb)
+#define __Pyx_ErrRestoreInState(tstate, type, value, tb)  PyErr_Restore(type, value, tb)
+#define __Pyx_ErrFetchInState(tstate, type, value, tb)  PyErr_Fetch(type, value, tb)
+#define __Pyx_ErrRestore(type, value, tb)  PyErr_Restore(type, value, tb)
+#define __Pyx_ErrFetch(type, value, tb)  PyErr_Fetch(type, value, tb)
+#endif
+
+/* GetTopmostException.proto */
+#if CYTHON_USE_EXC_INFO_STACK
+static _PyErr_StackItem * __Pyx_PyErr_GetTopmostException(PyThreadState *tstate);
+#endif
+
+/* SaveResetException.proto */
+#if CYTHON_FAST_THREAD_STATE
+#define __Pyx_ExceptionSave(type, value, tb)  __Pyx__ExceptionSave(__pyx_tstate, type, value, tb)
+static CYTHON_INLINE void __Pyx__ExceptionSave(PyThreadState *tstate, PyObject **type, PyObject **value, PyObject **tb);
+#define __Pyx_ExceptionReset(type, value, tb)  __Pyx__ExceptionReset(__pyx_tstate, type, value, tb)
+static CYTHON_INLINE void __Pyx__ExceptionReset(PyThreadState *tstate, PyObject *type, PyObject *value, PyObject *tb);
+#else
+#define __Pyx_ExceptionSave(type, value, tb)   PyErr_GetExcInfo(type, value, tb)
+#define __Pyx_ExceptionReset(type, value, tb)  PyErr_SetExcInfo(type, value, tb)
+#endif
+
+/* PyErrExceptionMatches.proto */
+#if CYTHON_FAST_THREAD_STATE
+#define __Pyx_PyErr_ExceptionMatches(err) __Pyx_PyErr_ExceptionMatchesInState(__pyx_tstate, err)
+static CYTHON_INLINE int __Pyx_PyErr_ExceptionMatchesInState(PyThreadState* tstate, PyObject* err);
+#else
+#define __Pyx_PyErr_ExceptionMatches(err)  PyErr_ExceptionMatches(err)
+#endif
+
+/* GetException.proto */
+#if CYTHON_FAST_THREAD_STATE
+#define __Pyx_GetException(type, value, tb)  __Pyx__GetException(__pyx_tstate, type, value, tb)
+static int __Pyx__GetException(PyThreadState *tstate, PyObject **type, PyObject **value, PyObject **tb);
+#else
+static int __Pyx_GetException(PyObject **type, PyObject **value, PyObject **tb);
+#endif
+
+/* RaiseException.proto */
+static void __Pyx_Raise(PyObject *type, PyObject *value, PyObject *tb, PyObject *cause);
+
+/* TypeImport.proto */
+#ifndef __PYX_HAVE_RT_ImportType_proto_0_29_37
+#define __PYX_HAVE_RT_ImportType_proto_0_29_37
+#if __STDC_VERSION__ >= 201112L
+#include <stdalign.h>
+#endif
+#if __STDC_VERSION__ >= 201112L || __cplusplus >= 201103L
+#define __PYX_GET_STRUCT_ALIGNMENT_0_29_37(s) alignof(s)
+#else
+#define __PYX_GET_STRUCT_ALIGNMENT_0_29_37(s) sizeof(void*)
+#endif
+enum __Pyx_ImportType_CheckSize_0_29_37 {
+   __Pyx_ImportType_CheckSize_Error_0_29_37 = 0,
+   __Pyx_ImportType_CheckSize_Warn_0_29_37 = 1,
+   __Pyx_ImportType_CheckSize_Ignore_0_29_37 = 2
+};
+static PyTypeObject *__Pyx_ImportType_0_29_37(PyObject* module, const char *module_name, const char *class_name, size_t size, size_t alignment, enum __Pyx_ImportType_CheckSize_0_29_37 check_size);
+#endif
+
+/* Import.proto */
+static PyObject *__Pyx_Import(PyObject *name, PyObject *from_list, int level);
+
+/* ImportFrom.proto */
+static PyObject* __Pyx_ImportFrom(PyObject* module, PyObject* name);
+
+/* CalculateMetaclass.proto */
+static PyObject *__Pyx_CalculateMetaclass(PyTypeObject *metaclass, PyObject *bases);
+
+/* SetNameInClass.proto */
+#if CYTHON_COMPILING_IN_CPYTHON && PY_VERSION_HEX >= 0x030500A1
+#define __Pyx_SetNameInClass(ns, name, value)\
+    (likely(PyDict_CheckExact(ns)) ? _PyDict_SetItem_KnownHash(ns, name, value, ((PyASCIIObject *) name)->hash) : PyObject_SetItem(ns, name, value))
+#elif CYTHON_COMPILING_IN_CPYTHON
+#define __Pyx_SetNameInClass(ns, name, value)\
+    (likely(PyDict_CheckExact(ns)) ? PyDict_SetItem(ns, name, value) : PyObject_SetItem(ns, name, value))
+#else
+#define __Pyx_SetNameInClass(ns, name, value)  PyObject_SetItem(ns, name, value)
+#endif
+
+/* Py3ClassCreate.proto */
+static PyObject *__Pyx_Py3MetaclassPrepare(PyObject *metaclass, PyObject *bases, PyObject *name, PyObject *qualname,
+                                           PyObject *mkw, PyObject *modname, PyObject *doc);
+static PyObject *__Pyx_Py3ClassCreate(PyObject *metaclass, PyObject *name, PyObject *bases, PyObject *dict,
+                                      PyObject *mkw, int calculate_metaclass, int allow_py2_metaclass);
+
+/* CLineInTraceback.proto */
+#ifdef CYTHON_CLINE_IN_TRACEBACK
+#define __Pyx_CLineForTraceback(tstate, c_line)  (((CYTHON_CLINE_IN_TRACEBACK)) ? c_line : 0)
+#else
+static int __Pyx_CLineForTraceback(PyThreadState *tstate, int c_line);
+#endif
+
+/* CodeObjectCache.proto */
+typedef struct {
+    PyCodeObject* code_object;
+    int code_line;
+} __Pyx_CodeObjectCacheEntry;
+struct __Pyx_CodeObjectCache {
+    int count;
+    int max_count;
+    __Pyx_CodeObjectCacheEntry* entries;
+};
+static struct __Pyx_CodeObjectCache __pyx_code_cache = {0,0,NULL};
+static int __pyx_bisect_code_objects(__Pyx_CodeObjectCacheEntry* entries, int count, int code_line);
+static PyCodeObject *__pyx_find_code_object(int code_line);
+static void __pyx_insert_code_object(int code_line, PyCodeObject* code_object);
+
+/* AddTraceback.proto */
+static void __Pyx_AddTraceback(const char *funcname, int c_line,
+                               int py_line, const char *filename);
+
+/* BufferStructDeclare.proto */
+typedef struct {
+  Py_ssize_t shape, strides, suboffsets;
+} __Pyx_Buf_DimInfo;
+typedef struct {
+  size_t refcount;
+  Py_buffer pybuffer;
+} __Pyx_Buffer;
+typedef struct {
+  __Pyx_Buffer *rcbuffer;
+  char *data;
+  __Pyx_Buf_DimInfo diminfo[8];
+} __Pyx_LocalBuf_ND;
+
+#if PY_MAJOR_VERSION < 3
+    static int __Pyx_GetBuffer(PyObject *obj, Py_buffer *view, int flags);
+    static void __Pyx_ReleaseBuffer(Py_buffer *view);
+#else
+    #define __Pyx_GetBuffer PyObject_GetBuffer
+    #define __Pyx_ReleaseBuffer PyBuffer_Release
+#endif
+
+
+/* GCCDiagnostics.proto */
+#if defined(__GNUC__) && (__GNUC__ > 4 || (__GNUC__ == 4 && __GNUC_MINOR__ >= 6))
+#define __Pyx_HAS_GCC_DIAGNOSTIC
+#endif
+
+/* RealImag.proto */
+#if CYTHON_CCOMPLEX
+  #ifdef __cplusplus
+    #define __Pyx_CREAL(z) ((z).real())
+    #define __Pyx_CIMAG(z) ((z).imag())
+  #else
+    #define __Pyx_CREAL(z) (__real__(z))
+    #define __Pyx_CIMAG(z) (__imag__(z))
+  #endif
+#else
+    #define __Pyx_CREAL(z) ((z).real)
+    #define __Pyx_CIMAG(z) ((z).imag)
+#endif
+#if defined(__cplusplus) && CYTHON_CCOMPLEX\
+        && (defined(_WIN32) || defined(__clang__) || (defined(__GNUC__) && (__GNUC__ >= 5 || __GNUC__ == 4 && __GNUC_MINOR__ >= 4 )) || __cplusplus >= 201103)
+    #define __Pyx_SET_CREAL(z,x) ((z).real(x))
+    #define __Pyx_SET_CIMAG(z,y) ((z).imag(y))
+#else
+    #define __Pyx_SET_CREAL(z,x) __Pyx_CREAL(z) = (x)
+    #define __Pyx_SET_CIMAG(z,y) __Pyx_CIMAG(z) = (y)
+#endif
+
+/* Arithmetic.proto */
+#if CYTHON_CCOMPLEX
+    #define __Pyx_c_eq_double(a, b)   ((a)==(b))
+    #define __Pyx_c_sum_double(a, b)  ((a)+(b))
+    #define __Pyx_c_diff_double(a, b) ((a)-(b))
+    #define __Pyx_c_prod_double(a, b) ((a)*(b))
+    #define __Pyx_c_quot_double(a, b) ((a)/(b))
+    #define __Pyx_c_neg_double(a)     (-(a))
+  #ifdef __cplusplus
+    #define __Pyx_c_is_zero_double(z) ((z)==(double)0)
+    #define __Pyx_c_conj_double(z)    (::std::conj(z))
+    #if 1
+        #define __Pyx_c_abs_double(z)     (::std::abs(z))
+        #define __Pyx_c_pow_double(a, b)  (::std::pow(a, b))
+    #endif
+  #else
+    #define __Pyx_c_is_zero_double(z) ((z)==0)
+    #define __Pyx_c_conj_double(z)    (conj(z))
+    #if 1
+        #define __Pyx_c_abs_double(z)     (cabs(z))
+        #define __Pyx_c_pow_double(a, b)  (cpow(a, b))
+    #endif
+ #endif
+#else
+    static CYTHON_INLINE int __Pyx_c_eq_double(__pyx_t_double_complex, __pyx_t_double_complex);
+    static CYTHON_INLINE __pyx_t_double_complex __Pyx_c_sum_double(__pyx_t_double_complex, __pyx_t_double_complex);
+    static CYTHON_INLINE __pyx_t_double_complex __Pyx_c_diff_double(__pyx_t_double_complex, __pyx_t_double_complex);
+    static CYTHON_INLINE __pyx_t_double_complex __Pyx_c_prod_double(__pyx_t_double_complex, __pyx_t_double_complex);
+    static CYTHON_INLINE __pyx_t_double_complex __Pyx_c_quot_double(__pyx_t_double_complex, __pyx_t_double_complex);
+    static CYTHON_INLINE __pyx_t_double_complex __Pyx_c_neg_double(__pyx_t_double_complex);
+    static CYTHON_INLINE int __Pyx_c_is_zero_double(__pyx_t_double_complex);
+    static CYTHON_INLINE __pyx_t_double_complex __Pyx_c_conj_double(__pyx_t_double_complex);
+    #if 1
+        static CYTHON_INLINE double __Pyx_c_abs_double(__pyx_t_double_complex);
+        static CYTHON_INLINE __pyx_t_double_complex __Pyx_c_pow_double(__pyx_t_double_complex, __pyx_t_double_complex);
+    #endif
+#endif
+
+/* Arithmetic.proto */
+#if CYTHON_CCOMPLEX
+    #define __Pyx_c_eq_float(a, b)   ((a)==(b))
+    #define __Pyx_c_sum_float(a, b)  ((a)+(b))
+    #define __Pyx_c_diff_float(a, b) ((a)-(b))
+    #define __Pyx_c_prod_float(a, b) ((a)*(b))
+    #define __Pyx_c_quot_float(a, b) ((a)/(b))
+    #define __Pyx_c_neg_float(a)     (-(a))
+  #ifdef __cplusplus
+    #define __Pyx_c_is_zero_float(z) ((z)==(float)0)
+    #define __Pyx_c_conj_float(z)    (::std::conj(z))
+    #if 1
+        #define __Pyx_c_abs_float(z)     (::std::abs(z))
+        #define __Pyx_c_pow_float(a, b)  (::std::pow(a, b))
+    #endif
+  #else
+    #define __Pyx_c_is_zero_float(z) ((z)==0)
+    #define __Pyx_c_conj_float(z)    (conjf(z))
+    #if 1
+        #define __Pyx_c_abs_float(z)     (cabsf(z))
+        #define __Pyx_c_pow_float(a, b)  (cpowf(a, b))
+    #endif
+ #endif
+#else
+    static CYTHON_INLINE int __Pyx_c_eq_float(__pyx_t_float_complex, __pyx_t_float_complex);
+    static CYTHON_INLINE __pyx_t_float_complex __Pyx_c_sum_float(__pyx_t_float_complex, __pyx_t_float_complex);
+    static CYTHON_INLINE __pyx_t_float_complex __Pyx_c_diff_float(__pyx_t_float_complex, __pyx_t_float_complex);
+    static CYTHON_INLINE __pyx_t_float_complex __Pyx_c_prod_float(__pyx_t_float_complex, __pyx_t_float_complex);
+    static CYTHON_INLINE __pyx_t_float_complex __Pyx_c_quot_float(__pyx_t_float_complex, __pyx_t_float_complex);
+    static CYTHON_INLINE __pyx_t_float_complex __Pyx_c_neg_float(__pyx_t_float_complex);
+    static CYTHON_INLINE int __Pyx_c_is_zero_float(__pyx_t_float_complex);
+    static CYTHON_INLINE __pyx_t_float_complex __Pyx_c_conj_float(__pyx_t_float_complex);
+    #if 1
+        static CYTHON_INLINE float __Pyx_c_abs_float(__pyx_t_float_complex);
+        static CYTHON_INLINE __pyx_t_float_complex __Pyx_c_pow_float(__pyx_t_float_complex, __pyx_t_float_complex);
+    #endif
+#endif
+
+/* CIntFromPy.proto */
+static CYTHON_INLINE npy_int64 __Pyx_PyInt_As_npy_int64(PyObject *);
+
+/* CIntFromPy.proto */
+static CYTHON_INLINE npy_long __Pyx_PyInt_As_npy_long(PyObject *);
+
+/* CIntToPy.proto */
+static CYTHON_INLINE PyObject* __Pyx_PyInt_From_npy_int64(npy_int64 value);
+
+/* CIntToPy.proto */
+static CYTHON_INLINE PyObject* __Pyx_PyInt_From_npy_long(npy_long value);
+
+/* CIntToPy.proto */
+static CYTHON_INLINE PyObject* __Pyx_PyInt_From_npy_uint8(npy_uint8 value);
+
+/* CIntFromPy.proto */
+static CYTHON_INLINE long __Pyx_PyInt_As_long(PyObject *);
+
+/* CIntToPy.proto */
+static CYTHON_INLINE PyObject* __Pyx_PyInt_From_long(long value);
+
+/* CIntFromPy.proto */
+static CYTHON_INLINE int __Pyx_PyInt_As_int(PyObject *);
+
+/* FastTypeChecks.proto */
+#if CYTHON_COMPILING_IN_CPYTHON
+#define __Pyx_TypeCheck(obj, type) __Pyx_IsSubtype(Py_TYPE(obj), (PyTypeObject *)type)
+static CYTHON_INLINE int __Pyx_IsSubtype(PyTypeObject *a, PyTypeObject *b);
+static CYTHON_INLINE int __Pyx_PyErr_GivenExceptionMatches(PyObject *err, PyObject *type);
+static CYTHON_INLINE int __Pyx_PyErr_GivenExceptionMatches2(PyObject *err, PyObject *type1, PyObject *type2);
+#else
+#define __Pyx_TypeCheck(obj, type) PyObject_TypeCheck(obj, (PyTypeObject *)type)
+#define __Pyx_PyErr_GivenExceptionMatches(err, type) PyErr_GivenExceptionMatches(err, type)
+#define __Pyx_PyErr_GivenExceptionMatches2(err, type1, type2) (PyErr_GivenExceptionMatches(err, type1) || PyErr_GivenExceptionMatches(err, type2))
+#endif
+#define __Pyx_PyException_Check(obj) __Pyx_TypeCheck(obj, PyExc_Exception)
+
+/* CheckBinaryVersion.proto */
+static int __Pyx_check_binary_version(void);
+
+/* InitStrings.proto */
+static int __Pyx_InitStrings(__Pyx_StringTabEntry *t);
+
+
+/* Module declarations from 'cpython.buffer' */
+
+/* Module declarations from 'libc.string' */
+
+/* Module declarations from 'libc.stdio' */
+
+/* Module declarations from '__builtin__' */
+
+/* Module declarations from 'cpython.type' */
+static PyTypeObject *__pyx_ptype_7cpython_4type_type = 0;
+
+/* Module declarations from 'cpython' */
+
+/* Module declarations from 'cpython.object' */
+
+/* Module declarations from 'cpython.ref' */
+
+/* Module declarations from 'cpython.mem' */
+
+/* Module declarations from 'numpy' */
+
+/* Module declarations from 'numpy' */
+static PyTypeObject *__pyx_ptype_5numpy_dtype = 0;
+static PyTypeObject *__pyx_ptype_5numpy_flatiter = 0;
+static PyTypeObject *__pyx_ptype_5numpy_broadcast = 0;
+static PyTypeObject *__pyx_ptype_5numpy_ndarray = 0;
+static PyTypeObject *__pyx_ptype_5numpy_generic = 0;
+static PyTypeObject *__pyx_ptype_5numpy_number = 0;
+static PyTypeObject *__pyx_ptype_5numpy_integer = 0;
+static PyTypeObject *__pyx_ptype_5numpy_signedinteger = 0;
+static PyTypeObject *__pyx_ptype_5numpy_unsignedinteger = 0;
+static PyTypeObject *__pyx_ptype_5numpy_inexact = 0;
+static PyTypeObject *__pyx_ptype_5numpy_floating = 0;
+static PyTypeObject *__pyx_ptype_5numpy_complexfloating = 0;
+static PyTypeObject *__pyx_ptype_5numpy_flexible = 0;
+static PyTypeObject *__pyx_ptype_5numpy_character = 0;
+static PyTypeObject *__pyx_ptype_5numpy_ufunc = 0;
+
+/* Module declarations from 'cython' */
+
+/* Module declarations from 'qmeq.approach.elph.c_redfield' */
+static __Pyx_TypeInfo __Pyx_TypeInfo_nn___pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t = { "double_t", NULL, sizeof(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t), { 0 }, 0, 'R', 0, 0 };
+static __Pyx_TypeInfo __Pyx_TypeInfo___pyx_t_double_complex = { "double complex", NULL, sizeof(__pyx_t_double_complex), { 0 }, 0, 'C', 0, 0 };
+static __Pyx_TypeInfo __Pyx_TypeInfo_nn___pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t = { "long_t", NULL, sizeof(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t), { 0 }, 0, IS_UNSIGNED(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t) ? 'U' : 'I', IS_UNSIGNED(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t), 0 };
+static __Pyx_TypeInfo __Pyx_TypeInfo_nn___pyx_t_4qmeq_8approach_4elph_10c_redfield_bool_t = { "bool_t", NULL, sizeof(__pyx_t_4qmeq_8approach_4elph_10c_redfield_bool_t), { 0 }, 0, IS_UNSIGNED(__pyx_t_4qmeq_8approach_4elph_10c_redfield_bool_t) ? 'U' : 'I', IS_UNSIGNED(__pyx_t_4qmeq_8approach_4elph_10c_redfield_bool_t), 0 };
+#define __Pyx_MODULE_NAME "qmeq.approach.elph.c_redfield"
+extern int __pyx_module_is_main_qmeq__approach__elph__c_redfield;
+int __pyx_module_is_main_qmeq__approach__elph__c_redfield = 0;
+
+/* Implementation of 'qmeq.approach.elph.c_redfield' */
+static PyObject *__pyx_builtin_range;
+static PyObject *__pyx_builtin_ImportError;
+static const char __pyx_k_E[] = "E";
+static const char __pyx_k_a[] = "a";
+static const char __pyx_k_b[] = "b";
+static const char __pyx_k_c[] = "c";
+static const char __pyx_k_l[] = "l";
+static const char __pyx_k_Ea[] = "Ea";
+static const char __pyx_k_ap[] = "ap";
+static const char __pyx_k_ba[] = "ba";
+static const char __pyx_k_bb[] = "bb";
+static const char __pyx_k_bp[] = "bp";
+static const char __pyx_k_cb[] = "cb";
+static const char __pyx_k_cp[] = "cp";
+static const char __pyx_k_np[] = "np";
+static const char __pyx_k_qd[] = "qd";
+static const char __pyx_k_si[] = "si";
+static const char __pyx_k_aap[] = "aap";
+static const char __pyx_k_bbp[] = "bbp";
+static const char __pyx_k_bpp[] = "bpp";
+static const char __pyx_k_ccp[] = "ccp";
+static const char __pyx_k_doc[] = "__doc__";
+static const char __pyx_k_Vbbp[] = "Vbbp";
+static const char __pyx_k_aapi[] = "aapi";
+static const char __pyx_k_bbpi[] = "bbpi";
+static const char __pyx_k_bbpp[] = "bbpp";
+static const char __pyx_k_bpap[] = "bpap";
+static const char __pyx_k_bppa[] = "bppa";
+static const char __pyx_k_cbpp[] = "cbpp";
+static const char __pyx_k_ccpi[] = "ccpi";
+static const char __pyx_k_cpbp[] = "cpbp";
+static const char __pyx_k_kern[] = "kern";
+static const char __pyx_k_main[] = "__main__";
+static const char __pyx_k_name[] = "__name__";
+static const char __pyx_k_ndm0[] = "ndm0";
+static const char __pyx_k_self[] = "self";
+static const char __pyx_k_test[] = "__test__";
+static const char __pyx_k_baths[] = "baths";
+static const char __pyx_k_bbppi[] = "bbppi";
+static const char __pyx_k_bppbp[] = "bppbp";
+static const char __pyx_k_dtype[] = "dtype";
+static const char __pyx_k_ndm0r[] = "ndm0r";
+static const char __pyx_k_numpy[] = "numpy";
+static const char __pyx_k_range[] = "range";
+static const char __pyx_k_w1fct[] = "w1fct";
+static const char __pyx_k_zeros[] = "zeros";
+static const char __pyx_k_bppbpi[] = "bppbpi";
+static const char __pyx_k_charge[] = "charge";
+static const char __pyx_k_dictdm[] = "dictdm";
+static const char __pyx_k_import[] = "__import__";
+static const char __pyx_k_lenlst[] = "lenlst";
+static const char __pyx_k_mapdm0[] = "mapdm0";
+static const char __pyx_k_module[] = "__module__";
+static const char __pyx_k_nbaths[] = "nbaths";
+static const char __pyx_k_npauli[] = "npauli";
+static const char __pyx_k_aap_sgn[] = "aap_sgn";
+static const char __pyx_k_booldm0[] = "booldm0";
+static const char __pyx_k_ccp_sgn[] = "ccp_sgn";
+static const char __pyx_k_conjdm0[] = "conjdm0";
+static const char __pyx_k_fct_aap[] = "fct_aap";
+static const char __pyx_k_fct_ccp[] = "fct_ccp";
+static const char __pyx_k_mytypes[] = "mytypes";
+static const char __pyx_k_ncharge[] = "ncharge";
+static const char __pyx_k_prepare[] = "__prepare__";
+static const char __pyx_k_product[] = "product";
+static const char __pyx_k_si_elph[] = "si_elph";
+static const char __pyx_k_Redfield[] = "Redfield";
+static const char __pyx_k_aprclass[] = "aprclass";
+static const char __pyx_k_bbp_bool[] = "bbp_bool";
+static const char __pyx_k_bbpp_sgn[] = "bbpp_sgn";
+static const char __pyx_k_doublenp[] = "doublenp";
+static const char __pyx_k_fct_bbpp[] = "fct_bbpp";
+static const char __pyx_k_kern_ext[] = "kern_ext";
+static const char __pyx_k_kerntype[] = "kerntype";
+static const char __pyx_k_mapdm0_2[] = "mapdm0_";
+static const char __pyx_k_qualname[] = "__qualname__";
+static const char __pyx_k_statesdm[] = "statesdm";
+static const char __pyx_k_bbpi_bool[] = "bbpi_bool";
+static const char __pyx_k_bppbp_sgn[] = "bppbp_sgn";
+static const char __pyx_k_complexnp[] = "complexnp";
+static const char __pyx_k_fct_bppbp[] = "fct_bppbp";
+static const char __pyx_k_itertools[] = "itertools";
+static const char __pyx_k_metaclass[] = "__metaclass__";
+static const char __pyx_k_shiftlst0[] = "shiftlst0";
+static const char __pyx_k_c_neumann1[] = "c_neumann1";
+static const char __pyx_k_ImportError[] = "ImportError";
+static const char __pyx_k_ApproachElPh[] = "ApproachElPh";
+static const char __pyx_k_base_c_pauli[] = "base.c_pauli";
+static const char __pyx_k_generate_fct[] = "generate_fct";
+static const char __pyx_k_generate_vec[] = "generate_vec";
+static const char __pyx_k_gamma_ba_bpap[] = "gamma_ba_bpap";
+static const char __pyx_k_gamma_ba_bppa[] = "gamma_ba_bppa";
+static const char __pyx_k_gamma_bc_bpcp[] = "gamma_bc_bpcp";
+static const char __pyx_k_gamma_bc_bppc[] = "gamma_bc_bppc";
+static const char __pyx_k_generate_kern[] = "generate_kern";
+static const char __pyx_k_gamma_abpp_abp[] = "gamma_abpp_abp";
+static const char __pyx_k_gamma_cbpp_cbp[] = "gamma_cbpp_cbp";
+static const char __pyx_k_base_c_neumann1[] = "base.c_neumann1";
+static const char __pyx_k_base_c_redfield[] = "base.c_redfield";
+static const char __pyx_k_ApproachRedfield[] = "ApproachRedfield";
+static const char __pyx_k_generate_current[] = "generate_current";
+static const char __pyx_k_generate_phi1fct[] = "generate_phi1fct";
+static const char __pyx_k_generate_fct_elph[] = "generate_fct_elph";
+static const char __pyx_k_generate_norm_vec[] = "generate_norm_vec";
+static const char __pyx_k_cline_in_traceback[] = "cline_in_traceback";
+static const char __pyx_k_generate_kern_elph[] = "generate_kern_elph";
+static const char __pyx_k_generate_w1fct_elph[] = "generate_w1fct_elph";
+static const char __pyx_k_generate_vec_redfield[] = "generate_vec_redfield";
+static const char __pyx_k_generate_kern_redfield[] = "generate_kern_redfield";
+static const char __pyx_k_generate_current_redfield[] = "generate_current_redfield";
+static const char __pyx_k_generate_kern_redfield_elph[] = "generate_kern_redfield_elph";
+static const char __pyx_k_combinations_with_replacement[] = "combinations_with_replacement";
+static const char __pyx_k_qmeq_approach_elph_c_redfield[] = "qmeq.approach.elph.c_redfield";
+static const char __pyx_k_numpy_core_multiarray_failed_to[] = "numpy.core.multiarray failed to import";
+static const char __pyx_k_Module_containing_cython_functio[] = "Module containing cython functions, which generate first order Redfield kernel.\n   For docstrings see documentation of module neumann1.";
+static const char __pyx_k_numpy_core_umath_failed_to_impor[] = "numpy.core.umath failed to import";
+static const char __pyx_k_qmeq_approach_elph_c_redfield_py[] = "qmeq/approach/elph/c_redfield.pyx";
+static PyObject *__pyx_n_s_ApproachElPh;
+static PyObject *__pyx_n_s_ApproachRedfield;
+static PyObject *__pyx_n_s_E;
+static PyObject *__pyx_n_s_Ea;
+static PyObject *__pyx_n_s_ImportError;
+static PyObject *__pyx_n_s_Redfield;
+static PyObject *__pyx_n_s_Vbbp;
+static PyObject *__pyx_n_s_a;
+static PyObject *__pyx_n_s_aap;
+static PyObject *__pyx_n_s_aap_sgn;
+static PyObject *__pyx_n_s_aapi;
+static PyObject *__pyx_n_s_ap;
+static PyObject *__pyx_n_s_aprclass;
+static PyObject *__pyx_n_s_b;
+static PyObject *__pyx_n_s_ba;
+static PyObject *__pyx_n_s_base_c_neumann1;
+static PyObject *__pyx_n_s_base_c_pauli;
+static PyObject *__pyx_n_s_base_c_redfield;
+static PyObject *__pyx_n_s_baths;
+static PyObject *__pyx_n_s_bb;
+static PyObject *__pyx_n_s_bbp;
+static PyObject *__pyx_n_s_bbp_bool;
+static PyObject *__pyx_n_s_bbpi;
+static PyObject *__pyx_n_s_bbpi_bool;
+static PyObject *__pyx_n_s_bbpp;
+static PyObject *__pyx_n_s_bbpp_sgn;
+static PyObject *__pyx_n_s_bbppi;
+static PyObject *__pyx_n_s_booldm0;
+static PyObject *__pyx_n_s_bp;
+static PyObject *__pyx_n_s_bpap;
+static PyObject *__pyx_n_s_bpp;
+static PyObject *__pyx_n_s_bppa;
+static PyObject *__pyx_n_s_bppbp;
+static PyObject *__pyx_n_s_bppbp_sgn;
+static PyObject *__pyx_n_s_bppbpi;
+static PyObject *__pyx_n_s_c;
+static PyObject *__pyx_n_s_c_neumann1;
+static PyObject *__pyx_n_s_cb;
+static PyObject *__pyx_n_s_cbpp;
+static PyObject *__pyx_n_s_ccp;
+static PyObject *__pyx_n_s_ccp_sgn;
+static PyObject *__pyx_n_s_ccpi;
+static PyObject *__pyx_n_s_charge;
+static PyObject *__pyx_n_s_cline_in_traceback;
+static PyObject *__pyx_n_s_combinations_with_replacement;
+static PyObject *__pyx_n_s_complexnp;
+static PyObject *__pyx_n_s_conjdm0;
+static PyObject *__pyx_n_s_cp;
+static PyObject *__pyx_n_s_cpbp;
+static PyObject *__pyx_n_s_dictdm;
+static PyObject *__pyx_n_s_doc;
+static PyObject *__pyx_n_s_doublenp;
+static PyObject *__pyx_n_s_dtype;
+static PyObject *__pyx_n_s_fct_aap;
+static PyObject *__pyx_n_s_fct_bbpp;
+static PyObject *__pyx_n_s_fct_bppbp;
+static PyObject *__pyx_n_s_fct_ccp;
+static PyObject *__pyx_n_s_gamma_abpp_abp;
+static PyObject *__pyx_n_s_gamma_ba_bpap;
+static PyObject *__pyx_n_s_gamma_ba_bppa;
+static PyObject *__pyx_n_s_gamma_bc_bpcp;
+static PyObject *__pyx_n_s_gamma_bc_bppc;
+static PyObject *__pyx_n_s_gamma_cbpp_cbp;
+static PyObject *__pyx_n_s_generate_current;
+static PyObject *__pyx_n_s_generate_current_redfield;
+static PyObject *__pyx_n_s_generate_fct;
+static PyObject *__pyx_n_s_generate_fct_elph;
+static PyObject *__pyx_n_s_generate_kern;
+static PyObject *__pyx_n_s_generate_kern_elph;
+static PyObject *__pyx_n_s_generate_kern_redfield;
+static PyObject *__pyx_n_s_generate_kern_redfield_elph;
+static PyObject *__pyx_n_s_generate_norm_vec;
+static PyObject *__pyx_n_s_generate_phi1fct;
+static PyObject *__pyx_n_s_generate_vec;
+static PyObject *__pyx_n_s_generate_vec_redfield;
+static PyObject *__pyx_n_s_generate_w1fct_elph;
+static PyObject *__pyx_n_s_import;
+static PyObject *__pyx_n_s_itertools;
+static PyObject *__pyx_n_s_kern;
+static PyObject *__pyx_n_s_kern_ext;
+static PyObject *__pyx_n_s_kerntype;
+static PyObject *__pyx_n_s_l;
+static PyObject *__pyx_n_s_lenlst;
+static PyObject *__pyx_n_s_main;
+static PyObject *__pyx_n_s_mapdm0;
+static PyObject *__pyx_n_s_mapdm0_2;
+static PyObject *__pyx_n_s_metaclass;
+static PyObject *__pyx_n_s_module;
+static PyObject *__pyx_n_s_mytypes;
+static PyObject *__pyx_n_s_name;
+static PyObject *__pyx_n_s_nbaths;
+static PyObject *__pyx_n_s_ncharge;
+static PyObject *__pyx_n_s_ndm0;
+static PyObject *__pyx_n_s_ndm0r;
+static PyObject *__pyx_n_s_np;
+static PyObject *__pyx_n_s_npauli;
+static PyObject *__pyx_n_s_numpy;
+static PyObject *__pyx_kp_s_numpy_core_multiarray_failed_to;
+static PyObject *__pyx_kp_s_numpy_core_umath_failed_to_impor;
+static PyObject *__pyx_n_s_prepare;
+static PyObject *__pyx_n_s_product;
+static PyObject *__pyx_n_s_qd;
+static PyObject *__pyx_n_s_qmeq_approach_elph_c_redfield;
+static PyObject *__pyx_kp_s_qmeq_approach_elph_c_redfield_py;
+static PyObject *__pyx_n_s_qualname;
+static PyObject *__pyx_n_s_range;
+static PyObject *__pyx_n_s_self;
+static PyObject *__pyx_n_s_shiftlst0;
+static PyObject *__pyx_n_s_si;
+static PyObject *__pyx_n_s_si_elph;
+static PyObject *__pyx_n_s_statesdm;
+static PyObject *__pyx_n_s_test;
+static PyObject *__pyx_n_s_w1fct;
+static PyObject *__pyx_n_s_zeros;
+static PyObject *__pyx_pf_4qmeq_8approach_4elph_10c_redfield_generate_kern_redfield_elph(CYTHON_UNUSED PyObject *__pyx_self, PyObject *__pyx_v_self); /* proto */
+static PyObject *__pyx_int_0;
+static PyObject *__pyx_int_2;
+static PyObject *__pyx_int_neg_1;
+static PyObject *__pyx_slice_;
+static PyObject *__pyx_slice__2;
+static PyObject *__pyx_tuple__3;
+static PyObject *__pyx_tuple__4;
+static PyObject *__pyx_tuple__5;
+static PyObject *__pyx_tuple__6;
+static PyObject *__pyx_codeobj__7;
+/* Late includes */
+
+/* "qmeq/approach/elph/c_redfield.pyx":36
+ * # ---------------------------------------------------------------------------------------------------------
+ * @cython.boundscheck(False)
+ * def generate_kern_redfield_elph(self):             # <<<<<<<<<<<<<<
+ *     cdef np.ndarray[double_t, ndim=1] E = self.qd.Ea
+ *     cdef np.ndarray[complex_t, ndim=3] Vbbp = self.baths.Vbbp
+ */
+
+/* Python wrapper */
+static PyObject *__pyx_pw_4qmeq_8approach_4elph_10c_redfield_1generate_kern_redfield_elph(PyObject *__pyx_self, PyObject *__pyx_v_self); /*proto*/
+static PyMethodDef __pyx_mdef_4qmeq_8approach_4elph_10c_redfield_1generate_kern_redfield_elph = {"generate_kern_redfield_elph", (PyCFunction)__pyx_pw_4qmeq_8approach_4elph_10c_redfield_1generate_kern_redfield_elph, METH_O, 0};
+static PyObject *__pyx_pw_4qmeq_8approach_4elph_10c_redfield_1generate_kern_redfield_elph(PyObject *__pyx_self, PyObject *__pyx_v_self) {
+  PyObject *__pyx_r = 0;
+  __Pyx_RefNannyDeclarations
+  __Pyx_RefNannySetupContext("generate_kern_redfield_elph (wrapper)", 0);
+  __pyx_r = __pyx_pf_4qmeq_8approach_4elph_10c_redfield_generate_kern_redfield_elph(__pyx_self, ((PyObject *)__pyx_v_self));
+
+  /* function exit code */
+  __Pyx_RefNannyFinishContext();
+  return __pyx_r;
+}
+
+static PyObject *__pyx_pf_4qmeq_8approach_4elph_10c_redfield_generate_kern_redfield_elph(CYTHON_UNUSED PyObject *__pyx_self, PyObject *__pyx_v_self) {
+  CYTHON_UNUSED PyArrayObject *__pyx_v_E = 0;
+  PyArrayObject *__pyx_v_Vbbp = 0;
+  PyArrayObject *__pyx_v_w1fct = 0;
+  PyObject *__pyx_v_si = NULL;
+  PyObject *__pyx_v_si_elph = NULL;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_bool_t __pyx_v_bbp_bool;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_bool_t __pyx_v_bbpi_bool;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t __pyx_v_charge;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t __pyx_v_l;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t __pyx_v_nbaths;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t __pyx_v_aap_sgn;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t __pyx_v_bppbp_sgn;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t __pyx_v_bbpp_sgn;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t __pyx_v_ccp_sgn;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_b;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_bp;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_bbp;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_bbpi;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_a;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_ap;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_aap;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_aapi;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_bpp;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_bppbp;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_bppbpi;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_bbpp;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_bbppi;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_c;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_cp;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_ccp;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_ccpi;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_bpap;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_ba;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_bppa;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_cbpp;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_cpbp;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_cb;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_ndm0;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_ndm0r;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_v_npauli;
+  __pyx_t_double_complex __pyx_v_fct_aap;
+  __pyx_t_double_complex __pyx_v_fct_bppbp;
+  __pyx_t_double_complex __pyx_v_fct_bbpp;
+  __pyx_t_double_complex __pyx_v_fct_ccp;
+  __pyx_t_double_complex __pyx_v_gamma_ba_bpap;
+  __pyx_t_double_complex __pyx_v_gamma_ba_bppa;
+  __pyx_t_double_complex __pyx_v_gamma_bc_bppc;
+  __pyx_t_double_complex __pyx_v_gamma_abpp_abp;
+  __pyx_t_double_complex __pyx_v_gamma_cbpp_cbp;
+  __pyx_t_double_complex __pyx_v_gamma_bc_bpcp;
+  PyArrayObject *__pyx_v_lenlst = 0;
+  PyArrayObject *__pyx_v_dictdm = 0;
+  PyArrayObject *__pyx_v_shiftlst0 = 0;
+  PyArrayObject *__pyx_v_mapdm0 = 0;
+  PyArrayObject *__pyx_v_booldm0 = 0;
+  PyArrayObject *__pyx_v_conjdm0 = 0;
+  PyArrayObject *__pyx_v_mapdm0_ = 0;
+  PyArrayObject *__pyx_v_kern = 0;
+  __Pyx_LocalBuf_ND __pyx_pybuffernd_E;
+  __Pyx_Buffer __pyx_pybuffer_E;
+  __Pyx_LocalBuf_ND __pyx_pybuffernd_Vbbp;
+  __Pyx_Buffer __pyx_pybuffer_Vbbp;
+  __Pyx_LocalBuf_ND __pyx_pybuffernd_booldm0;
+  __Pyx_Buffer __pyx_pybuffer_booldm0;
+  __Pyx_LocalBuf_ND __pyx_pybuffernd_conjdm0;
+  __Pyx_Buffer __pyx_pybuffer_conjdm0;
+  __Pyx_LocalBuf_ND __pyx_pybuffernd_dictdm;
+  __Pyx_Buffer __pyx_pybuffer_dictdm;
+  __Pyx_LocalBuf_ND __pyx_pybuffernd_kern;
+  __Pyx_Buffer __pyx_pybuffer_kern;
+  __Pyx_LocalBuf_ND __pyx_pybuffernd_lenlst;
+  __Pyx_Buffer __pyx_pybuffer_lenlst;
+  __Pyx_LocalBuf_ND __pyx_pybuffernd_mapdm0;
+  __Pyx_Buffer __pyx_pybuffer_mapdm0;
+  __Pyx_LocalBuf_ND __pyx_pybuffernd_mapdm0_;
+  __Pyx_Buffer __pyx_pybuffer_mapdm0_;
+  __Pyx_LocalBuf_ND __pyx_pybuffernd_shiftlst0;
+  __Pyx_Buffer __pyx_pybuffer_shiftlst0;
+  __Pyx_LocalBuf_ND __pyx_pybuffernd_w1fct;
+  __Pyx_Buffer __pyx_pybuffer_w1fct;
+  PyObject *__pyx_r = NULL;
+  __Pyx_RefNannyDeclarations
+  PyObject *__pyx_t_1 = NULL;
+  PyObject *__pyx_t_2 = NULL;
+  PyArrayObject *__pyx_t_3 = NULL;
+  PyArrayObject *__pyx_t_4 = NULL;
+  PyArrayObject *__pyx_t_5 = NULL;
+  PyArrayObject *__pyx_t_6 = NULL;
+  PyArrayObject *__pyx_t_7 = NULL;
+  PyArrayObject *__pyx_t_8 = NULL;
+  PyArrayObject *__pyx_t_9 = NULL;
+  PyArrayObject *__pyx_t_10 = NULL;
+  PyArrayObject *__pyx_t_11 = NULL;
+  PyArrayObject *__pyx_t_12 = NULL;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_t_13;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_t_14;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_t_15;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t __pyx_t_16;
+  int __pyx_t_17;
+  int __pyx_t_18;
+  PyObject *__pyx_t_19 = NULL;
+  PyObject *__pyx_t_20 = NULL;
+  int __pyx_t_21;
+  PyObject *__pyx_t_22 = NULL;
+  PyArrayObject *__pyx_t_23 = NULL;
+  long __pyx_t_24;
+  long __pyx_t_25;
+  Py_ssize_t __pyx_t_26;
+  PyObject *(*__pyx_t_27)(PyObject *);
+  PyObject *(*__pyx_t_28)(PyObject *);
+  Py_ssize_t __pyx_t_29;
+  Py_ssize_t __pyx_t_30;
+  PyObject *__pyx_t_31 = NULL;
+  PyObject *__pyx_t_32 = NULL;
+  Py_ssize_t __pyx_t_33;
+  PyObject *(*__pyx_t_34)(PyObject *);
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t __pyx_t_35;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t __pyx_t_36;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t __pyx_t_37;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_t_38;
+  Py_ssize_t __pyx_t_39;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_t_40;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_t_41;
+  Py_ssize_t __pyx_t_42;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_t_43;
+  __pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t __pyx_t_44;
+  Py_ssize_t __pyx_t_45;
+  PyObject *(*__pyx_t_46)(PyObject *);
+  int __pyx_lineno = 0;
+  const char *__pyx_filename = NULL;
+  int __pyx_clineno = 0;
+  __Pyx_RefNannySetupContext("generate_kern_redfield_elph", 0);
+  __pyx_pybuffer_E.pybuffer.buf = NULL;
+  __pyx_pybuffer_E.refcount = 0;
+  __pyx_pybuffernd_E.data = NULL;
+  __pyx_pybuffernd_E.rcbuffer = &__pyx_pybuffer_E;
+  __pyx_pybuffer_Vbbp.pybuffer.buf = NULL;
+  __pyx_pybuffer_Vbbp.refcount = 0;
+  __pyx_pybuffernd_Vbbp.data = NULL;
+  __pyx_pybuffernd_Vbbp.rcbuffer = &__pyx_pybuffer_Vbbp;
+  __pyx_pybuffer_w1fct.pybuffer.buf = NULL;
+  __pyx_pybuffer_w1fct.refcount = 0;
+  __pyx_pybuffernd_w1fct.data = NULL;
+  __pyx_pybuffernd_w1fct.rcbuffer = &__pyx_pybuffer_w1fct;
+  __pyx_pybuffer_lenlst.pybuffer.buf = NULL;
+  __pyx_pybuffer_lenlst.refcount = 0;
+  __pyx_pybuffernd_lenlst.data = NULL;
+  __pyx_pybuffernd_lenlst.rcbuffer = &__pyx_pybuffer_lenlst;
+  __pyx_pybuffer_dictdm.pybuffer.buf = NULL;
+  __pyx_pybuffer_dictdm.refcount = 0;
+  __pyx_pybuffernd_dictdm.data = NULL;
+  __pyx_pybuffernd_dictdm.rcbuffer = &__pyx_pybuffer_dictdm;
+  __pyx_pybuffer_shiftlst0.pybuffer.buf = NULL;
+  __pyx_pybuffer_shiftlst0.refcount = 0;
+  __pyx_pybuffernd_shiftlst0.data = NULL;
+  __pyx_pybuffernd_shiftlst0.rcbuffer = &__pyx_pybuffer_shiftlst0;
+  __pyx_pybuffer_mapdm0.pybuffer.buf = NULL;
+  __pyx_pybuffer_mapdm0.refcount = 0;
+  __pyx_pybuffernd_mapdm0.data = NULL;
+  __pyx_pybuffernd_mapdm0.rcbuffer = &__pyx_pybuffer_mapdm0;
+  __pyx_pybuffer_booldm0.pybuffer.buf = NULL;
+  __pyx_pybuffer_booldm0.refcount = 0;
+  __pyx_pybuffernd_booldm0.data = NULL;
+  __pyx_pybuffernd_booldm0.rcbuffer = &__pyx_pybuffer_booldm0;
+  __pyx_pybuffer_conjdm0.pybuffer.buf = NULL;
+  __pyx_pybuffer_conjdm0.refcount = 0;
+  __pyx_pybuffernd_conjdm0.data = NULL;
+  __pyx_pybuffernd_conjdm0.rcbuffer = &__pyx_pybuffer_conjdm0;
+  __pyx_pybuffer_mapdm0_.pybuffer.buf = NULL;
+  __pyx_pybuffer_mapdm0_.refcount = 0;
+  __pyx_pybuffernd_mapdm0_.data = NULL;
+  __pyx_pybuffernd_mapdm0_.rcbuffer = &__pyx_pybuffer_mapdm0_;
+  __pyx_pybuffer_kern.pybuffer.buf = NULL;
+  __pyx_pybuffer_kern.refcount = 0;
+  __pyx_pybuffernd_kern.data = NULL;
+  __pyx_pybuffernd_kern.rcbuffer = &__pyx_pybuffer_kern;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":37
+ * @cython.boundscheck(False)
+ * def generate_kern_redfield_elph(self):
+ *     cdef np.ndarray[double_t, ndim=1] E = self.qd.Ea             # <<<<<<<<<<<<<<
+ *     cdef np.ndarray[complex_t, ndim=3] Vbbp = self.baths.Vbbp
+ *     cdef np.ndarray[complex_t, ndim=3] w1fct = self.w1fct
+ */
+  __pyx_t_1 = __Pyx_PyObject_GetAttrStr(__pyx_v_self, __pyx_n_s_qd); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 37, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_t_1, __pyx_n_s_Ea); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 37, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+  if (!(likely(((__pyx_t_2) == Py_None) || likely(__Pyx_TypeTest(__pyx_t_2, __pyx_ptype_5numpy_ndarray))))) __PYX_ERR(0, 37, __pyx_L1_error)
+  __pyx_t_3 = ((PyArrayObject *)__pyx_t_2);
+  {
+    __Pyx_BufFmt_StackElem __pyx_stack[1];
+    if (unlikely(__Pyx_GetBufferAndValidate(&__pyx_pybuffernd_E.rcbuffer->pybuffer, (PyObject*)__pyx_t_3, &__Pyx_TypeInfo_nn___pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t, PyBUF_FORMAT| PyBUF_STRIDES, 1, 0, __pyx_stack) == -1)) {
+      __pyx_v_E = ((PyArrayObject *)Py_None); __Pyx_INCREF(Py_None); __pyx_pybuffernd_E.rcbuffer->pybuffer.buf = NULL;
+      __PYX_ERR(0, 37, __pyx_L1_error)
+    } else {__pyx_pybuffernd_E.diminfo[0].strides = __pyx_pybuffernd_E.rcbuffer->pybuffer.strides[0]; __pyx_pybuffernd_E.diminfo[0].shape = __pyx_pybuffernd_E.rcbuffer->pybuffer.shape[0];
+    }
+  }
+  __pyx_t_3 = 0;
+  __pyx_v_E = ((PyArrayObject *)__pyx_t_2);
+  __pyx_t_2 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":38
+ * def generate_kern_redfield_elph(self):
+ *     cdef np.ndarray[double_t, ndim=1] E = self.qd.Ea
+ *     cdef np.ndarray[complex_t, ndim=3] Vbbp = self.baths.Vbbp             # <<<<<<<<<<<<<<
+ *     cdef np.ndarray[complex_t, ndim=3] w1fct = self.w1fct
+ *     si, si_elph = self.si, self.si_elph
+ */
+  __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_self, __pyx_n_s_baths); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 38, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __pyx_t_1 = __Pyx_PyObject_GetAttrStr(__pyx_t_2, __pyx_n_s_Vbbp); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 38, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+  if (!(likely(((__pyx_t_1) == Py_None) || likely(__Pyx_TypeTest(__pyx_t_1, __pyx_ptype_5numpy_ndarray))))) __PYX_ERR(0, 38, __pyx_L1_error)
+  __pyx_t_4 = ((PyArrayObject *)__pyx_t_1);
+  {
+    __Pyx_BufFmt_StackElem __pyx_stack[1];
+    if (unlikely(__Pyx_GetBufferAndValidate(&__pyx_pybuffernd_Vbbp.rcbuffer->pybuffer, (PyObject*)__pyx_t_4, &__Pyx_TypeInfo___pyx_t_double_complex, PyBUF_FORMAT| PyBUF_STRIDES, 3, 0, __pyx_stack) == -1)) {
+      __pyx_v_Vbbp = ((PyArrayObject *)Py_None); __Pyx_INCREF(Py_None); __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf = NULL;
+      __PYX_ERR(0, 38, __pyx_L1_error)
+    } else {__pyx_pybuffernd_Vbbp.diminfo[0].strides = __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.strides[0]; __pyx_pybuffernd_Vbbp.diminfo[0].shape = __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.shape[0]; __pyx_pybuffernd_Vbbp.diminfo[1].strides = __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.strides[1]; __pyx_pybuffernd_Vbbp.diminfo[1].shape = __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.shape[1]; __pyx_pybuffernd_Vbbp.diminfo[2].strides = __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.strides[2]; __pyx_pybuffernd_Vbbp.diminfo[2].shape = __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.shape[2];
+    }
+  }
+  __pyx_t_4 = 0;
+  __pyx_v_Vbbp = ((PyArrayObject *)__pyx_t_1);
+  __pyx_t_1 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":39
+ *     cdef np.ndarray[double_t, ndim=1] E = self.qd.Ea
+ *     cdef np.ndarray[complex_t, ndim=3] Vbbp = self.baths.Vbbp
+ *     cdef np.ndarray[complex_t, ndim=3] w1fct = self.w1fct             # <<<<<<<<<<<<<<
+ *     si, si_elph = self.si, self.si_elph
+ *     #
+ */
+  __pyx_t_1 = __Pyx_PyObject_GetAttrStr(__pyx_v_self, __pyx_n_s_w1fct); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 39, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  if (!(likely(((__pyx_t_1) == Py_None) || likely(__Pyx_TypeTest(__pyx_t_1, __pyx_ptype_5numpy_ndarray))))) __PYX_ERR(0, 39, __pyx_L1_error)
+  __pyx_t_5 = ((PyArrayObject *)__pyx_t_1);
+  {
+    __Pyx_BufFmt_StackElem __pyx_stack[1];
+    if (unlikely(__Pyx_GetBufferAndValidate(&__pyx_pybuffernd_w1fct.rcbuffer->pybuffer, (PyObject*)__pyx_t_5, &__Pyx_TypeInfo___pyx_t_double_complex, PyBUF_FORMAT| PyBUF_STRIDES, 3, 0, __pyx_stack) == -1)) {
+      __pyx_v_w1fct = ((PyArrayObject *)Py_None); __Pyx_INCREF(Py_None); __pyx_pybuffernd_w1fct.rcbuffer->pybuffer.buf = NULL;
+      __PYX_ERR(0, 39, __pyx_L1_error)
+    } else {__pyx_pybuffernd_w1fct.diminfo[0].strides = __pyx_pybuffernd_w1fct.rcbuffer->pybuffer.strides[0]; __pyx_pybuffernd_w1fct.diminfo[0].shape = __pyx_pybuffernd_w1fct.rcbuffer->pybuffer.shape[0]; __pyx_pybuffernd_w1fct.diminfo[1].strides = __pyx_pybuffernd_w1fct.rcbuffer->pybuffer.strides[1]; __pyx_pybuffernd_w1fct.diminfo[1].shape = __pyx_pybuffernd_w1fct.rcbuffer->pybuffer.shape[1]; __pyx_pybuffernd_w1fct.diminfo[2].strides = __pyx_pybuffernd_w1fct.rcbuffer->pybuffer.strides[2]; __pyx_pybuffernd_w1fct.diminfo[2].shape = __pyx_pybuffernd_w1fct.rcbuffer->pybuffer.shape[2];
+    }
+  }
+  __pyx_t_5 = 0;
+  __pyx_v_w1fct = ((PyArrayObject *)__pyx_t_1);
+  __pyx_t_1 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":40
+ *     cdef np.ndarray[complex_t, ndim=3] Vbbp = self.baths.Vbbp
+ *     cdef np.ndarray[complex_t, ndim=3] w1fct = self.w1fct
+ *     si, si_elph = self.si, self.si_elph             # <<<<<<<<<<<<<<
+ *     #
+ *     cdef bool_t bbp_bool, bbpi_bool
+ */
+  __pyx_t_1 = __Pyx_PyObject_GetAttrStr(__pyx_v_self, __pyx_n_s_si); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 40, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_self, __pyx_n_s_si_elph); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 40, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __pyx_v_si = __pyx_t_1;
+  __pyx_t_1 = 0;
+  __pyx_v_si_elph = __pyx_t_2;
+  __pyx_t_2 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":55
+ *                    gamma_abpp_abp, gamma_cbpp_cbp, gamma_bc_bpcp
+ *     #
+ *     cdef np.ndarray[long_t, ndim=1] lenlst = si.lenlst             # <<<<<<<<<<<<<<
+ *     cdef np.ndarray[long_t, ndim=1] dictdm = si.dictdm
+ *     cdef np.ndarray[long_t, ndim=1] shiftlst0 = si.shiftlst0
+ */
+  __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_lenlst); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 55, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  if (!(likely(((__pyx_t_2) == Py_None) || likely(__Pyx_TypeTest(__pyx_t_2, __pyx_ptype_5numpy_ndarray))))) __PYX_ERR(0, 55, __pyx_L1_error)
+  __pyx_t_6 = ((PyArrayObject *)__pyx_t_2);
+  {
+    __Pyx_BufFmt_StackElem __pyx_stack[1];
+    if (unlikely(__Pyx_GetBufferAndValidate(&__pyx_pybuffernd_lenlst.rcbuffer->pybuffer, (PyObject*)__pyx_t_6, &__Pyx_TypeInfo_nn___pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t, PyBUF_FORMAT| PyBUF_STRIDES, 1, 0, __pyx_stack) == -1)) {
+      __pyx_v_lenlst = ((PyArrayObject *)Py_None); __Pyx_INCREF(Py_None); __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf = NULL;
+      __PYX_ERR(0, 55, __pyx_L1_error)
+    } else {__pyx_pybuffernd_lenlst.diminfo[0].strides = __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.strides[0]; __pyx_pybuffernd_lenlst.diminfo[0].shape = __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.shape[0];
+    }
+  }
+  __pyx_t_6 = 0;
+  __pyx_v_lenlst = ((PyArrayObject *)__pyx_t_2);
+  __pyx_t_2 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":56
+ *     #
+ *     cdef np.ndarray[long_t, ndim=1] lenlst = si.lenlst
+ *     cdef np.ndarray[long_t, ndim=1] dictdm = si.dictdm             # <<<<<<<<<<<<<<
+ *     cdef np.ndarray[long_t, ndim=1] shiftlst0 = si.shiftlst0
+ *     cdef np.ndarray[long_t, ndim=1] mapdm0 = si.mapdm0
+ */
+  __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_dictdm); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 56, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  if (!(likely(((__pyx_t_2) == Py_None) || likely(__Pyx_TypeTest(__pyx_t_2, __pyx_ptype_5numpy_ndarray))))) __PYX_ERR(0, 56, __pyx_L1_error)
+  __pyx_t_7 = ((PyArrayObject *)__pyx_t_2);
+  {
+    __Pyx_BufFmt_StackElem __pyx_stack[1];
+    if (unlikely(__Pyx_GetBufferAndValidate(&__pyx_pybuffernd_dictdm.rcbuffer->pybuffer, (PyObject*)__pyx_t_7, &__Pyx_TypeInfo_nn___pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t, PyBUF_FORMAT| PyBUF_STRIDES, 1, 0, __pyx_stack) == -1)) {
+      __pyx_v_dictdm = ((PyArrayObject *)Py_None); __Pyx_INCREF(Py_None); __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf = NULL;
+      __PYX_ERR(0, 56, __pyx_L1_error)
+    } else {__pyx_pybuffernd_dictdm.diminfo[0].strides = __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.strides[0]; __pyx_pybuffernd_dictdm.diminfo[0].shape = __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.shape[0];
+    }
+  }
+  __pyx_t_7 = 0;
+  __pyx_v_dictdm = ((PyArrayObject *)__pyx_t_2);
+  __pyx_t_2 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":57
+ *     cdef np.ndarray[long_t, ndim=1] lenlst = si.lenlst
+ *     cdef np.ndarray[long_t, ndim=1] dictdm = si.dictdm
+ *     cdef np.ndarray[long_t, ndim=1] shiftlst0 = si.shiftlst0             # <<<<<<<<<<<<<<
+ *     cdef np.ndarray[long_t, ndim=1] mapdm0 = si.mapdm0
+ *     cdef np.ndarray[bool_t, ndim=1] booldm0 = si.booldm0
+ */
+  __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_shiftlst0); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 57, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  if (!(likely(((__pyx_t_2) == Py_None) || likely(__Pyx_TypeTest(__pyx_t_2, __pyx_ptype_5numpy_ndarray))))) __PYX_ERR(0, 57, __pyx_L1_error)
+  __pyx_t_8 = ((PyArrayObject *)__pyx_t_2);
+  {
+    __Pyx_BufFmt_StackElem __pyx_stack[1];
+    if (unlikely(__Pyx_GetBufferAndValidate(&__pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer, (PyObject*)__pyx_t_8, &__Pyx_TypeInfo_nn___pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t, PyBUF_FORMAT| PyBUF_STRIDES, 1, 0, __pyx_stack) == -1)) {
+      __pyx_v_shiftlst0 = ((PyArrayObject *)Py_None); __Pyx_INCREF(Py_None); __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf = NULL;
+      __PYX_ERR(0, 57, __pyx_L1_error)
+    } else {__pyx_pybuffernd_shiftlst0.diminfo[0].strides = __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.strides[0]; __pyx_pybuffernd_shiftlst0.diminfo[0].shape = __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.shape[0];
+    }
+  }
+  __pyx_t_8 = 0;
+  __pyx_v_shiftlst0 = ((PyArrayObject *)__pyx_t_2);
+  __pyx_t_2 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":58
+ *     cdef np.ndarray[long_t, ndim=1] dictdm = si.dictdm
+ *     cdef np.ndarray[long_t, ndim=1] shiftlst0 = si.shiftlst0
+ *     cdef np.ndarray[long_t, ndim=1] mapdm0 = si.mapdm0             # <<<<<<<<<<<<<<
+ *     cdef np.ndarray[bool_t, ndim=1] booldm0 = si.booldm0
+ *     cdef np.ndarray[bool_t, ndim=1] conjdm0 = si.conjdm0
+ */
+  __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_mapdm0); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 58, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  if (!(likely(((__pyx_t_2) == Py_None) || likely(__Pyx_TypeTest(__pyx_t_2, __pyx_ptype_5numpy_ndarray))))) __PYX_ERR(0, 58, __pyx_L1_error)
+  __pyx_t_9 = ((PyArrayObject *)__pyx_t_2);
+  {
+    __Pyx_BufFmt_StackElem __pyx_stack[1];
+    if (unlikely(__Pyx_GetBufferAndValidate(&__pyx_pybuffernd_mapdm0.rcbuffer->pybuffer, (PyObject*)__pyx_t_9, &__Pyx_TypeInfo_nn___pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t, PyBUF_FORMAT| PyBUF_STRIDES, 1, 0, __pyx_stack) == -1)) {
+      __pyx_v_mapdm0 = ((PyArrayObject *)Py_None); __Pyx_INCREF(Py_None); __pyx_pybuffernd_mapdm0.rcbuffer->pybuffer.buf = NULL;
+      __PYX_ERR(0, 58, __pyx_L1_error)
+    } else {__pyx_pybuffernd_mapdm0.diminfo[0].strides = __pyx_pybuffernd_mapdm0.rcbuffer->pybuffer.strides[0]; __pyx_pybuffernd_mapdm0.diminfo[0].shape = __pyx_pybuffernd_mapdm0.rcbuffer->pybuffer.shape[0];
+    }
+  }
+  __pyx_t_9 = 0;
+  __pyx_v_mapdm0 = ((PyArrayObject *)__pyx_t_2);
+  __pyx_t_2 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":59
+ *     cdef np.ndarray[long_t, ndim=1] shiftlst0 = si.shiftlst0
+ *     cdef np.ndarray[long_t, ndim=1] mapdm0 = si.mapdm0
+ *     cdef np.ndarray[bool_t, ndim=1] booldm0 = si.booldm0             # <<<<<<<<<<<<<<
+ *     cdef np.ndarray[bool_t, ndim=1] conjdm0 = si.conjdm0
+ *     #
+ */
+  __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_booldm0); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 59, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  if (!(likely(((__pyx_t_2) == Py_None) || likely(__Pyx_TypeTest(__pyx_t_2, __pyx_ptype_5numpy_ndarray))))) __PYX_ERR(0, 59, __pyx_L1_error)
+  __pyx_t_10 = ((PyArrayObject *)__pyx_t_2);
+  {
+    __Pyx_BufFmt_StackElem __pyx_stack[1];
+    if (unlikely(__Pyx_GetBufferAndValidate(&__pyx_pybuffernd_booldm0.rcbuffer->pybuffer, (PyObject*)__pyx_t_10, &__Pyx_TypeInfo_nn___pyx_t_4qmeq_8approach_4elph_10c_redfield_bool_t, PyBUF_FORMAT| PyBUF_STRIDES, 1, 0, __pyx_stack) == -1)) {
+      __pyx_v_booldm0 = ((PyArrayObject *)Py_None); __Pyx_INCREF(Py_None); __pyx_pybuffernd_booldm0.rcbuffer->pybuffer.buf = NULL;
+      __PYX_ERR(0, 59, __pyx_L1_error)
+    } else {__pyx_pybuffernd_booldm0.diminfo[0].strides = __pyx_pybuffernd_booldm0.rcbuffer->pybuffer.strides[0]; __pyx_pybuffernd_booldm0.diminfo[0].shape = __pyx_pybuffernd_booldm0.rcbuffer->pybuffer.shape[0];
+    }
+  }
+  __pyx_t_10 = 0;
+  __pyx_v_booldm0 = ((PyArrayObject *)__pyx_t_2);
+  __pyx_t_2 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":60
+ *     cdef np.ndarray[long_t, ndim=1] mapdm0 = si.mapdm0
+ *     cdef np.ndarray[bool_t, ndim=1] booldm0 = si.booldm0
+ *     cdef np.ndarray[bool_t, ndim=1] conjdm0 = si.conjdm0             # <<<<<<<<<<<<<<
+ *     #
+ *     cdef np.ndarray[long_t, ndim=1] mapdm0_ = si_elph.mapdm0
+ */
+  __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_conjdm0); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 60, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  if (!(likely(((__pyx_t_2) == Py_None) || likely(__Pyx_TypeTest(__pyx_t_2, __pyx_ptype_5numpy_ndarray))))) __PYX_ERR(0, 60, __pyx_L1_error)
+  __pyx_t_11 = ((PyArrayObject *)__pyx_t_2);
+  {
+    __Pyx_BufFmt_StackElem __pyx_stack[1];
+    if (unlikely(__Pyx_GetBufferAndValidate(&__pyx_pybuffernd_conjdm0.rcbuffer->pybuffer, (PyObject*)__pyx_t_11, &__Pyx_TypeInfo_nn___pyx_t_4qmeq_8approach_4elph_10c_redfield_bool_t, PyBUF_FORMAT| PyBUF_STRIDES, 1, 0, __pyx_stack) == -1)) {
+      __pyx_v_conjdm0 = ((PyArrayObject *)Py_None); __Pyx_INCREF(Py_None); __pyx_pybuffernd_conjdm0.rcbuffer->pybuffer.buf = NULL;
+      __PYX_ERR(0, 60, __pyx_L1_error)
+    } else {__pyx_pybuffernd_conjdm0.diminfo[0].strides = __pyx_pybuffernd_conjdm0.rcbuffer->pybuffer.strides[0]; __pyx_pybuffernd_conjdm0.diminfo[0].shape = __pyx_pybuffernd_conjdm0.rcbuffer->pybuffer.shape[0];
+    }
+  }
+  __pyx_t_11 = 0;
+  __pyx_v_conjdm0 = ((PyArrayObject *)__pyx_t_2);
+  __pyx_t_2 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":62
+ *     cdef np.ndarray[bool_t, ndim=1] conjdm0 = si.conjdm0
+ *     #
+ *     cdef np.ndarray[long_t, ndim=1] mapdm0_ = si_elph.mapdm0             # <<<<<<<<<<<<<<
+ *     #
+ *     ndm0r, ndm0, npauli, nbaths = si.ndm0r, si.ndm0, si.npauli, si.nbaths
+ */
+  __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_si_elph, __pyx_n_s_mapdm0); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 62, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  if (!(likely(((__pyx_t_2) == Py_None) || likely(__Pyx_TypeTest(__pyx_t_2, __pyx_ptype_5numpy_ndarray))))) __PYX_ERR(0, 62, __pyx_L1_error)
+  __pyx_t_12 = ((PyArrayObject *)__pyx_t_2);
+  {
+    __Pyx_BufFmt_StackElem __pyx_stack[1];
+    if (unlikely(__Pyx_GetBufferAndValidate(&__pyx_pybuffernd_mapdm0_.rcbuffer->pybuffer, (PyObject*)__pyx_t_12, &__Pyx_TypeInfo_nn___pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t, PyBUF_FORMAT| PyBUF_STRIDES, 1, 0, __pyx_stack) == -1)) {
+      __pyx_v_mapdm0_ = ((PyArrayObject *)Py_None); __Pyx_INCREF(Py_None); __pyx_pybuffernd_mapdm0_.rcbuffer->pybuffer.buf = NULL;
+      __PYX_ERR(0, 62, __pyx_L1_error)
+    } else {__pyx_pybuffernd_mapdm0_.diminfo[0].strides = __pyx_pybuffernd_mapdm0_.rcbuffer->pybuffer.strides[0]; __pyx_pybuffernd_mapdm0_.diminfo[0].shape = __pyx_pybuffernd_mapdm0_.rcbuffer->pybuffer.shape[0];
+    }
+  }
+  __pyx_t_12 = 0;
+  __pyx_v_mapdm0_ = ((PyArrayObject *)__pyx_t_2);
+  __pyx_t_2 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":64
+ *     cdef np.ndarray[long_t, ndim=1] mapdm0_ = si_elph.mapdm0
+ *     #
+ *     ndm0r, ndm0, npauli, nbaths = si.ndm0r, si.ndm0, si.npauli, si.nbaths             # <<<<<<<<<<<<<<
+ *     #
+ *     if self.kern is None:
+ */
+  __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_ndm0r); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 64, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __pyx_t_13 = __Pyx_PyInt_As_npy_int64(__pyx_t_2); if (unlikely((__pyx_t_13 == ((npy_int64)-1)) && PyErr_Occurred())) __PYX_ERR(0, 64, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+  __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_ndm0); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 64, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __pyx_t_14 = __Pyx_PyInt_As_npy_int64(__pyx_t_2); if (unlikely((__pyx_t_14 == ((npy_int64)-1)) && PyErr_Occurred())) __PYX_ERR(0, 64, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+  __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_npauli); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 64, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __pyx_t_15 = __Pyx_PyInt_As_npy_int64(__pyx_t_2); if (unlikely((__pyx_t_15 == ((npy_int64)-1)) && PyErr_Occurred())) __PYX_ERR(0, 64, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+  __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_nbaths); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 64, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __pyx_t_16 = __Pyx_PyInt_As_npy_long(__pyx_t_2); if (unlikely((__pyx_t_16 == ((npy_long)-1)) && PyErr_Occurred())) __PYX_ERR(0, 64, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+  __pyx_v_ndm0r = __pyx_t_13;
+  __pyx_v_ndm0 = __pyx_t_14;
+  __pyx_v_npauli = __pyx_t_15;
+  __pyx_v_nbaths = __pyx_t_16;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":66
+ *     ndm0r, ndm0, npauli, nbaths = si.ndm0r, si.ndm0, si.npauli, si.nbaths
+ *     #
+ *     if self.kern is None:             # <<<<<<<<<<<<<<
+ *         self.kern_ext = np.zeros((ndm0r+1, ndm0r), dtype=doublenp)
+ *         self.kern = self.kern_ext[0:-1, :]
+ */
+  __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_self, __pyx_n_s_kern); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 66, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __pyx_t_17 = (__pyx_t_2 == Py_None);
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+  __pyx_t_18 = (__pyx_t_17 != 0);
+  if (__pyx_t_18) {
+
+    /* "qmeq/approach/elph/c_redfield.pyx":67
+ *     #
+ *     if self.kern is None:
+ *         self.kern_ext = np.zeros((ndm0r+1, ndm0r), dtype=doublenp)             # <<<<<<<<<<<<<<
+ *         self.kern = self.kern_ext[0:-1, :]
+ *         generate_norm_vec(self, ndm0r)
+ */
+    __Pyx_GetModuleGlobalName(__pyx_t_2, __pyx_n_s_np); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 67, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_2);
+    __pyx_t_1 = __Pyx_PyObject_GetAttrStr(__pyx_t_2, __pyx_n_s_zeros); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 67, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_1);
+    __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+    __pyx_t_2 = __Pyx_PyInt_From_npy_int64((__pyx_v_ndm0r + 1)); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 67, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_2);
+    __pyx_t_19 = __Pyx_PyInt_From_npy_int64(__pyx_v_ndm0r); if (unlikely(!__pyx_t_19)) __PYX_ERR(0, 67, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_19);
+    __pyx_t_20 = PyTuple_New(2); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 67, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_20);
+    __Pyx_GIVEREF(__pyx_t_2);
+    PyTuple_SET_ITEM(__pyx_t_20, 0, __pyx_t_2);
+    __Pyx_GIVEREF(__pyx_t_19);
+    PyTuple_SET_ITEM(__pyx_t_20, 1, __pyx_t_19);
+    __pyx_t_2 = 0;
+    __pyx_t_19 = 0;
+    __pyx_t_19 = PyTuple_New(1); if (unlikely(!__pyx_t_19)) __PYX_ERR(0, 67, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_19);
+    __Pyx_GIVEREF(__pyx_t_20);
+    PyTuple_SET_ITEM(__pyx_t_19, 0, __pyx_t_20);
+    __pyx_t_20 = 0;
+    __pyx_t_20 = __Pyx_PyDict_NewPresized(1); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 67, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_20);
+    __Pyx_GetModuleGlobalName(__pyx_t_2, __pyx_n_s_doublenp); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 67, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_2);
+    if (PyDict_SetItem(__pyx_t_20, __pyx_n_s_dtype, __pyx_t_2) < 0) __PYX_ERR(0, 67, __pyx_L1_error)
+    __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+    __pyx_t_2 = __Pyx_PyObject_Call(__pyx_t_1, __pyx_t_19, __pyx_t_20); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 67, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_2);
+    __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+    __Pyx_DECREF(__pyx_t_19); __pyx_t_19 = 0;
+    __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+    if (__Pyx_PyObject_SetAttrStr(__pyx_v_self, __pyx_n_s_kern_ext, __pyx_t_2) < 0) __PYX_ERR(0, 67, __pyx_L1_error)
+    __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+
+    /* "qmeq/approach/elph/c_redfield.pyx":68
+ *     if self.kern is None:
+ *         self.kern_ext = np.zeros((ndm0r+1, ndm0r), dtype=doublenp)
+ *         self.kern = self.kern_ext[0:-1, :]             # <<<<<<<<<<<<<<
+ *         generate_norm_vec(self, ndm0r)
+ * 
+ */
+    __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_self, __pyx_n_s_kern_ext); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 68, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_2);
+    __pyx_t_20 = __Pyx_PyObject_GetItem(__pyx_t_2, __pyx_tuple__3); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 68, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_20);
+    __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+    if (__Pyx_PyObject_SetAttrStr(__pyx_v_self, __pyx_n_s_kern, __pyx_t_20) < 0) __PYX_ERR(0, 68, __pyx_L1_error)
+    __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+
+    /* "qmeq/approach/elph/c_redfield.pyx":69
+ *         self.kern_ext = np.zeros((ndm0r+1, ndm0r), dtype=doublenp)
+ *         self.kern = self.kern_ext[0:-1, :]
+ *         generate_norm_vec(self, ndm0r)             # <<<<<<<<<<<<<<
+ * 
+ *     cdef np.ndarray[double_t, ndim=2] kern = self.kern
+ */
+    __Pyx_GetModuleGlobalName(__pyx_t_2, __pyx_n_s_generate_norm_vec); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 69, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_2);
+    __pyx_t_19 = __Pyx_PyInt_From_npy_int64(__pyx_v_ndm0r); if (unlikely(!__pyx_t_19)) __PYX_ERR(0, 69, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_19);
+    __pyx_t_1 = NULL;
+    __pyx_t_21 = 0;
+    if (CYTHON_UNPACK_METHODS && unlikely(PyMethod_Check(__pyx_t_2))) {
+      __pyx_t_1 = PyMethod_GET_SELF(__pyx_t_2);
+      if (likely(__pyx_t_1)) {
+        PyObject* function = PyMethod_GET_FUNCTION(__pyx_t_2);
+        __Pyx_INCREF(__pyx_t_1);
+        __Pyx_INCREF(function);
+        __Pyx_DECREF_SET(__pyx_t_2, function);
+        __pyx_t_21 = 1;
+      }
+    }
+    #if CYTHON_FAST_PYCALL
+    if (PyFunction_Check(__pyx_t_2)) {
+      PyObject *__pyx_temp[3] = {__pyx_t_1, __pyx_v_self, __pyx_t_19};
+      __pyx_t_20 = __Pyx_PyFunction_FastCall(__pyx_t_2, __pyx_temp+1-__pyx_t_21, 2+__pyx_t_21); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 69, __pyx_L1_error)
+      __Pyx_XDECREF(__pyx_t_1); __pyx_t_1 = 0;
+      __Pyx_GOTREF(__pyx_t_20);
+      __Pyx_DECREF(__pyx_t_19); __pyx_t_19 = 0;
+    } else
+    #endif
+    #if CYTHON_FAST_PYCCALL
+    if (__Pyx_PyFastCFunction_Check(__pyx_t_2)) {
+      PyObject *__pyx_temp[3] = {__pyx_t_1, __pyx_v_self, __pyx_t_19};
+      __pyx_t_20 = __Pyx_PyCFunction_FastCall(__pyx_t_2, __pyx_temp+1-__pyx_t_21, 2+__pyx_t_21); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 69, __pyx_L1_error)
+      __Pyx_XDECREF(__pyx_t_1); __pyx_t_1 = 0;
+      __Pyx_GOTREF(__pyx_t_20);
+      __Pyx_DECREF(__pyx_t_19); __pyx_t_19 = 0;
+    } else
+    #endif
+    {
+      __pyx_t_22 = PyTuple_New(2+__pyx_t_21); if (unlikely(!__pyx_t_22)) __PYX_ERR(0, 69, __pyx_L1_error)
+      __Pyx_GOTREF(__pyx_t_22);
+      if (__pyx_t_1) {
+        __Pyx_GIVEREF(__pyx_t_1); PyTuple_SET_ITEM(__pyx_t_22, 0, __pyx_t_1); __pyx_t_1 = NULL;
+      }
+      __Pyx_INCREF(__pyx_v_self);
+      __Pyx_GIVEREF(__pyx_v_self);
+      PyTuple_SET_ITEM(__pyx_t_22, 0+__pyx_t_21, __pyx_v_self);
+      __Pyx_GIVEREF(__pyx_t_19);
+      PyTuple_SET_ITEM(__pyx_t_22, 1+__pyx_t_21, __pyx_t_19);
+      __pyx_t_19 = 0;
+      __pyx_t_20 = __Pyx_PyObject_Call(__pyx_t_2, __pyx_t_22, NULL); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 69, __pyx_L1_error)
+      __Pyx_GOTREF(__pyx_t_20);
+      __Pyx_DECREF(__pyx_t_22); __pyx_t_22 = 0;
+    }
+    __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+    __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+
+    /* "qmeq/approach/elph/c_redfield.pyx":66
+ *     ndm0r, ndm0, npauli, nbaths = si.ndm0r, si.ndm0, si.npauli, si.nbaths
+ *     #
+ *     if self.kern is None:             # <<<<<<<<<<<<<<
+ *         self.kern_ext = np.zeros((ndm0r+1, ndm0r), dtype=doublenp)
+ *         self.kern = self.kern_ext[0:-1, :]
+ */
+  }
+
+  /* "qmeq/approach/elph/c_redfield.pyx":71
+ *         generate_norm_vec(self, ndm0r)
+ * 
+ *     cdef np.ndarray[double_t, ndim=2] kern = self.kern             # <<<<<<<<<<<<<<
+ *     for charge in range(si.ncharge):
+ *         for b, bp in itertools.combinations_with_replacement(si.statesdm[charge], 2):
+ */
+  __pyx_t_20 = __Pyx_PyObject_GetAttrStr(__pyx_v_self, __pyx_n_s_kern); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 71, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_20);
+  if (!(likely(((__pyx_t_20) == Py_None) || likely(__Pyx_TypeTest(__pyx_t_20, __pyx_ptype_5numpy_ndarray))))) __PYX_ERR(0, 71, __pyx_L1_error)
+  __pyx_t_23 = ((PyArrayObject *)__pyx_t_20);
+  {
+    __Pyx_BufFmt_StackElem __pyx_stack[1];
+    if (unlikely(__Pyx_GetBufferAndValidate(&__pyx_pybuffernd_kern.rcbuffer->pybuffer, (PyObject*)__pyx_t_23, &__Pyx_TypeInfo_nn___pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t, PyBUF_FORMAT| PyBUF_STRIDES| PyBUF_WRITABLE, 2, 0, __pyx_stack) == -1)) {
+      __pyx_v_kern = ((PyArrayObject *)Py_None); __Pyx_INCREF(Py_None); __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf = NULL;
+      __PYX_ERR(0, 71, __pyx_L1_error)
+    } else {__pyx_pybuffernd_kern.diminfo[0].strides = __pyx_pybuffernd_kern.rcbuffer->pybuffer.strides[0]; __pyx_pybuffernd_kern.diminfo[0].shape = __pyx_pybuffernd_kern.rcbuffer->pybuffer.shape[0]; __pyx_pybuffernd_kern.diminfo[1].strides = __pyx_pybuffernd_kern.rcbuffer->pybuffer.strides[1]; __pyx_pybuffernd_kern.diminfo[1].shape = __pyx_pybuffernd_kern.rcbuffer->pybuffer.shape[1];
+    }
+  }
+  __pyx_t_23 = 0;
+  __pyx_v_kern = ((PyArrayObject *)__pyx_t_20);
+  __pyx_t_20 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":72
+ * 
+ *     cdef np.ndarray[double_t, ndim=2] kern = self.kern
+ *     for charge in range(si.ncharge):             # <<<<<<<<<<<<<<
+ *         for b, bp in itertools.combinations_with_replacement(si.statesdm[charge], 2):
+ *             bbp = mapdm0[lenlst[charge]*dictdm[b] + dictdm[bp] + shiftlst0[charge]]
+ */
+  __pyx_t_20 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_ncharge); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 72, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_20);
+  __pyx_t_24 = __Pyx_PyInt_As_long(__pyx_t_20); if (unlikely((__pyx_t_24 == (long)-1) && PyErr_Occurred())) __PYX_ERR(0, 72, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+  __pyx_t_25 = __pyx_t_24;
+  for (__pyx_t_16 = 0; __pyx_t_16 < __pyx_t_25; __pyx_t_16+=1) {
+    __pyx_v_charge = __pyx_t_16;
+
+    /* "qmeq/approach/elph/c_redfield.pyx":73
+ *     cdef np.ndarray[double_t, ndim=2] kern = self.kern
+ *     for charge in range(si.ncharge):
+ *         for b, bp in itertools.combinations_with_replacement(si.statesdm[charge], 2):             # <<<<<<<<<<<<<<
+ *             bbp = mapdm0[lenlst[charge]*dictdm[b] + dictdm[bp] + shiftlst0[charge]]
+ *             bbp_bool = booldm0[lenlst[charge]*dictdm[b] + dictdm[bp] + shiftlst0[charge]]
+ */
+    __Pyx_GetModuleGlobalName(__pyx_t_2, __pyx_n_s_itertools); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 73, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_2);
+    __pyx_t_22 = __Pyx_PyObject_GetAttrStr(__pyx_t_2, __pyx_n_s_combinations_with_replacement); if (unlikely(!__pyx_t_22)) __PYX_ERR(0, 73, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_22);
+    __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+    __pyx_t_2 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_statesdm); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 73, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_2);
+    __pyx_t_19 = __Pyx_GetItemInt(__pyx_t_2, __pyx_v_charge, __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t, 1, __Pyx_PyInt_From_npy_long, 0, 1, 0); if (unlikely(!__pyx_t_19)) __PYX_ERR(0, 73, __pyx_L1_error)
+    __Pyx_GOTREF(__pyx_t_19);
+    __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+    __pyx_t_2 = NULL;
+    __pyx_t_21 = 0;
+    if (CYTHON_UNPACK_METHODS && unlikely(PyMethod_Check(__pyx_t_22))) {
+      __pyx_t_2 = PyMethod_GET_SELF(__pyx_t_22);
+      if (likely(__pyx_t_2)) {
+        PyObject* function = PyMethod_GET_FUNCTION(__pyx_t_22);
+        __Pyx_INCREF(__pyx_t_2);
+        __Pyx_INCREF(function);
+        __Pyx_DECREF_SET(__pyx_t_22, function);
+        __pyx_t_21 = 1;
+      }
+    }
+    #if CYTHON_FAST_PYCALL
+    if (PyFunction_Check(__pyx_t_22)) {
+      PyObject *__pyx_temp[3] = {__pyx_t_2, __pyx_t_19, __pyx_int_2};
+      __pyx_t_20 = __Pyx_PyFunction_FastCall(__pyx_t_22, __pyx_temp+1-__pyx_t_21, 2+__pyx_t_21); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 73, __pyx_L1_error)
+      __Pyx_XDECREF(__pyx_t_2); __pyx_t_2 = 0;
+      __Pyx_GOTREF(__pyx_t_20);
+      __Pyx_DECREF(__pyx_t_19); __pyx_t_19 = 0;
+    } else
+    #endif
+    #if CYTHON_FAST_PYCCALL
+    if (__Pyx_PyFastCFunction_Check(__pyx_t_22)) {
+      PyObject *__pyx_temp[3] = {__pyx_t_2, __pyx_t_19, __pyx_int_2};
+      __pyx_t_20 = __Pyx_PyCFunction_FastCall(__pyx_t_22, __pyx_temp+1-__pyx_t_21, 2+__pyx_t_21); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 73, __pyx_L1_error)
+      __Pyx_XDECREF(__pyx_t_2); __pyx_t_2 = 0;
+      __Pyx_GOTREF(__pyx_t_20);
+      __Pyx_DECREF(__pyx_t_19); __pyx_t_19 = 0;
+    } else
+    #endif
+    {
+      __pyx_t_1 = PyTuple_New(2+__pyx_t_21); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 73, __pyx_L1_error)
+      __Pyx_GOTREF(__pyx_t_1);
+      if (__pyx_t_2) {
+        __Pyx_GIVEREF(__pyx_t_2); PyTuple_SET_ITEM(__pyx_t_1, 0, __pyx_t_2); __pyx_t_2 = NULL;
+      }
+      __Pyx_GIVEREF(__pyx_t_19);
+      PyTuple_SET_ITEM(__pyx_t_1, 0+__pyx_t_21, __pyx_t_19);
+      __Pyx_INCREF(__pyx_int_2);
+      __Pyx_GIVEREF(__pyx_int_2);
+      PyTuple_SET_ITEM(__pyx_t_1, 1+__pyx_t_21, __pyx_int_2);
+      __pyx_t_19 = 0;
+      __pyx_t_20 = __Pyx_PyObject_Call(__pyx_t_22, __pyx_t_1, NULL); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 73, __pyx_L1_error)
+      __Pyx_GOTREF(__pyx_t_20);
+      __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+    }
+    __Pyx_DECREF(__pyx_t_22); __pyx_t_22 = 0;
+    if (likely(PyList_CheckExact(__pyx_t_20)) || PyTuple_CheckExact(__pyx_t_20)) {
+      __pyx_t_22 = __pyx_t_20; __Pyx_INCREF(__pyx_t_22); __pyx_t_26 = 0;
+      __pyx_t_27 = NULL;
+    } else {
+      __pyx_t_26 = -1; __pyx_t_22 = PyObject_GetIter(__pyx_t_20); if (unlikely(!__pyx_t_22)) __PYX_ERR(0, 73, __pyx_L1_error)
+      __Pyx_GOTREF(__pyx_t_22);
+      __pyx_t_27 = Py_TYPE(__pyx_t_22)->tp_iternext; if (unlikely(!__pyx_t_27)) __PYX_ERR(0, 73, __pyx_L1_error)
+    }
+    __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+    for (;;) {
+      if (likely(!__pyx_t_27)) {
+        if (likely(PyList_CheckExact(__pyx_t_22))) {
+          if (__pyx_t_26 >= PyList_GET_SIZE(__pyx_t_22)) break;
+          #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+          __pyx_t_20 = PyList_GET_ITEM(__pyx_t_22, __pyx_t_26); __Pyx_INCREF(__pyx_t_20); __pyx_t_26++; if (unlikely(0 < 0)) __PYX_ERR(0, 73, __pyx_L1_error)
+          #else
+          __pyx_t_20 = PySequence_ITEM(__pyx_t_22, __pyx_t_26); __pyx_t_26++; if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 73, __pyx_L1_error)
+          __Pyx_GOTREF(__pyx_t_20);
+          #endif
+        } else {
+          if (__pyx_t_26 >= PyTuple_GET_SIZE(__pyx_t_22)) break;
+          #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+          __pyx_t_20 = PyTuple_GET_ITEM(__pyx_t_22, __pyx_t_26); __Pyx_INCREF(__pyx_t_20); __pyx_t_26++; if (unlikely(0 < 0)) __PYX_ERR(0, 73, __pyx_L1_error)
+          #else
+          __pyx_t_20 = PySequence_ITEM(__pyx_t_22, __pyx_t_26); __pyx_t_26++; if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 73, __pyx_L1_error)
+          __Pyx_GOTREF(__pyx_t_20);
+          #endif
+        }
+      } else {
+        __pyx_t_20 = __pyx_t_27(__pyx_t_22);
+        if (unlikely(!__pyx_t_20)) {
+          PyObject* exc_type = PyErr_Occurred();
+          if (exc_type) {
+            if (likely(__Pyx_PyErr_GivenExceptionMatches(exc_type, PyExc_StopIteration))) PyErr_Clear();
+            else __PYX_ERR(0, 73, __pyx_L1_error)
+          }
+          break;
+        }
+        __Pyx_GOTREF(__pyx_t_20);
+      }
+      if ((likely(PyTuple_CheckExact(__pyx_t_20))) || (PyList_CheckExact(__pyx_t_20))) {
+        PyObject* sequence = __pyx_t_20;
+        Py_ssize_t size = __Pyx_PySequence_SIZE(sequence);
+        if (unlikely(size != 2)) {
+          if (size > 2) __Pyx_RaiseTooManyValuesError(2);
+          else if (size >= 0) __Pyx_RaiseNeedMoreValuesError(size);
+          __PYX_ERR(0, 73, __pyx_L1_error)
+        }
+        #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+        if (likely(PyTuple_CheckExact(sequence))) {
+          __pyx_t_1 = PyTuple_GET_ITEM(sequence, 0); 
+          __pyx_t_19 = PyTuple_GET_ITEM(sequence, 1); 
+        } else {
+          __pyx_t_1 = PyList_GET_ITEM(sequence, 0); 
+          __pyx_t_19 = PyList_GET_ITEM(sequence, 1); 
+        }
+        __Pyx_INCREF(__pyx_t_1);
+        __Pyx_INCREF(__pyx_t_19);
+        #else
+        __pyx_t_1 = PySequence_ITEM(sequence, 0); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 73, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_1);
+        __pyx_t_19 = PySequence_ITEM(sequence, 1); if (unlikely(!__pyx_t_19)) __PYX_ERR(0, 73, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_19);
+        #endif
+        __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+      } else {
+        Py_ssize_t index = -1;
+        __pyx_t_2 = PyObject_GetIter(__pyx_t_20); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 73, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_2);
+        __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+        __pyx_t_28 = Py_TYPE(__pyx_t_2)->tp_iternext;
+        index = 0; __pyx_t_1 = __pyx_t_28(__pyx_t_2); if (unlikely(!__pyx_t_1)) goto __pyx_L8_unpacking_failed;
+        __Pyx_GOTREF(__pyx_t_1);
+        index = 1; __pyx_t_19 = __pyx_t_28(__pyx_t_2); if (unlikely(!__pyx_t_19)) goto __pyx_L8_unpacking_failed;
+        __Pyx_GOTREF(__pyx_t_19);
+        if (__Pyx_IternextUnpackEndCheck(__pyx_t_28(__pyx_t_2), 2) < 0) __PYX_ERR(0, 73, __pyx_L1_error)
+        __pyx_t_28 = NULL;
+        __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+        goto __pyx_L9_unpacking_done;
+        __pyx_L8_unpacking_failed:;
+        __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+        __pyx_t_28 = NULL;
+        if (__Pyx_IterFinish() == 0) __Pyx_RaiseNeedMoreValuesError(index);
+        __PYX_ERR(0, 73, __pyx_L1_error)
+        __pyx_L9_unpacking_done:;
+      }
+      __pyx_t_15 = __Pyx_PyInt_As_npy_int64(__pyx_t_1); if (unlikely((__pyx_t_15 == ((npy_int64)-1)) && PyErr_Occurred())) __PYX_ERR(0, 73, __pyx_L1_error)
+      __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+      __pyx_t_14 = __Pyx_PyInt_As_npy_int64(__pyx_t_19); if (unlikely((__pyx_t_14 == ((npy_int64)-1)) && PyErr_Occurred())) __PYX_ERR(0, 73, __pyx_L1_error)
+      __Pyx_DECREF(__pyx_t_19); __pyx_t_19 = 0;
+      __pyx_v_b = __pyx_t_15;
+      __pyx_v_bp = __pyx_t_14;
+
+      /* "qmeq/approach/elph/c_redfield.pyx":74
+ *     for charge in range(si.ncharge):
+ *         for b, bp in itertools.combinations_with_replacement(si.statesdm[charge], 2):
+ *             bbp = mapdm0[lenlst[charge]*dictdm[b] + dictdm[bp] + shiftlst0[charge]]             # <<<<<<<<<<<<<<
+ *             bbp_bool = booldm0[lenlst[charge]*dictdm[b] + dictdm[bp] + shiftlst0[charge]]
+ *             if bbp != -1 and bbp_bool:
+ */
+      __pyx_t_29 = __pyx_v_charge;
+      if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+      __pyx_t_14 = __pyx_v_b;
+      if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+      __pyx_t_15 = __pyx_v_bp;
+      if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+      __pyx_t_30 = __pyx_v_charge;
+      if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+      __pyx_t_13 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_14, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_15, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+      if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_mapdm0.diminfo[0].shape;
+      __pyx_v_bbp = (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_mapdm0.rcbuffer->pybuffer.buf, __pyx_t_13, __pyx_pybuffernd_mapdm0.diminfo[0].strides));
+
+      /* "qmeq/approach/elph/c_redfield.pyx":75
+ *         for b, bp in itertools.combinations_with_replacement(si.statesdm[charge], 2):
+ *             bbp = mapdm0[lenlst[charge]*dictdm[b] + dictdm[bp] + shiftlst0[charge]]
+ *             bbp_bool = booldm0[lenlst[charge]*dictdm[b] + dictdm[bp] + shiftlst0[charge]]             # <<<<<<<<<<<<<<
+ *             if bbp != -1 and bbp_bool:
+ *                 bbpi = ndm0 + bbp - npauli
+ */
+      __pyx_t_30 = __pyx_v_charge;
+      if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+      __pyx_t_15 = __pyx_v_b;
+      if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+      __pyx_t_14 = __pyx_v_bp;
+      if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+      __pyx_t_29 = __pyx_v_charge;
+      if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+      __pyx_t_13 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_15, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_14, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+      if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_booldm0.diminfo[0].shape;
+      __pyx_v_bbp_bool = (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_bool_t *, __pyx_pybuffernd_booldm0.rcbuffer->pybuffer.buf, __pyx_t_13, __pyx_pybuffernd_booldm0.diminfo[0].strides));
+
+      /* "qmeq/approach/elph/c_redfield.pyx":76
+ *             bbp = mapdm0[lenlst[charge]*dictdm[b] + dictdm[bp] + shiftlst0[charge]]
+ *             bbp_bool = booldm0[lenlst[charge]*dictdm[b] + dictdm[bp] + shiftlst0[charge]]
+ *             if bbp != -1 and bbp_bool:             # <<<<<<<<<<<<<<
+ *                 bbpi = ndm0 + bbp - npauli
+ *                 bbpi_bool = True if bbpi >= ndm0 else False
+ */
+      __pyx_t_17 = ((__pyx_v_bbp != -1LL) != 0);
+      if (__pyx_t_17) {
+      } else {
+        __pyx_t_18 = __pyx_t_17;
+        goto __pyx_L11_bool_binop_done;
+      }
+      __pyx_t_17 = (__pyx_v_bbp_bool != 0);
+      __pyx_t_18 = __pyx_t_17;
+      __pyx_L11_bool_binop_done:;
+      if (__pyx_t_18) {
+
+        /* "qmeq/approach/elph/c_redfield.pyx":77
+ *             bbp_bool = booldm0[lenlst[charge]*dictdm[b] + dictdm[bp] + shiftlst0[charge]]
+ *             if bbp != -1 and bbp_bool:
+ *                 bbpi = ndm0 + bbp - npauli             # <<<<<<<<<<<<<<
+ *                 bbpi_bool = True if bbpi >= ndm0 else False
+ *                 # --------------------------------------------------
+ */
+        __pyx_v_bbpi = ((__pyx_v_ndm0 + __pyx_v_bbp) - __pyx_v_npauli);
+
+        /* "qmeq/approach/elph/c_redfield.pyx":78
+ *             if bbp != -1 and bbp_bool:
+ *                 bbpi = ndm0 + bbp - npauli
+ *                 bbpi_bool = True if bbpi >= ndm0 else False             # <<<<<<<<<<<<<<
+ *                 # --------------------------------------------------
+ *                 for a, ap in itertools.product(si.statesdm[charge], si.statesdm[charge]):
+ */
+        if (((__pyx_v_bbpi >= __pyx_v_ndm0) != 0)) {
+          __pyx_t_18 = 1;
+        } else {
+          __pyx_t_18 = 0;
+        }
+        __pyx_v_bbpi_bool = __pyx_t_18;
+
+        /* "qmeq/approach/elph/c_redfield.pyx":80
+ *                 bbpi_bool = True if bbpi >= ndm0 else False
+ *                 # --------------------------------------------------
+ *                 for a, ap in itertools.product(si.statesdm[charge], si.statesdm[charge]):             # <<<<<<<<<<<<<<
+ *                     aap = mapdm0[lenlst[charge]*dictdm[a] + dictdm[ap] + shiftlst0[charge]]
+ *                     if aap != -1:
+ */
+        __Pyx_GetModuleGlobalName(__pyx_t_19, __pyx_n_s_itertools); if (unlikely(!__pyx_t_19)) __PYX_ERR(0, 80, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_19);
+        __pyx_t_1 = __Pyx_PyObject_GetAttrStr(__pyx_t_19, __pyx_n_s_product); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 80, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_1);
+        __Pyx_DECREF(__pyx_t_19); __pyx_t_19 = 0;
+        __pyx_t_19 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_statesdm); if (unlikely(!__pyx_t_19)) __PYX_ERR(0, 80, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_19);
+        __pyx_t_2 = __Pyx_GetItemInt(__pyx_t_19, __pyx_v_charge, __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t, 1, __Pyx_PyInt_From_npy_long, 0, 1, 0); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 80, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_2);
+        __Pyx_DECREF(__pyx_t_19); __pyx_t_19 = 0;
+        __pyx_t_19 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_statesdm); if (unlikely(!__pyx_t_19)) __PYX_ERR(0, 80, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_19);
+        __pyx_t_31 = __Pyx_GetItemInt(__pyx_t_19, __pyx_v_charge, __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t, 1, __Pyx_PyInt_From_npy_long, 0, 1, 0); if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 80, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_31);
+        __Pyx_DECREF(__pyx_t_19); __pyx_t_19 = 0;
+        __pyx_t_19 = NULL;
+        __pyx_t_21 = 0;
+        if (CYTHON_UNPACK_METHODS && unlikely(PyMethod_Check(__pyx_t_1))) {
+          __pyx_t_19 = PyMethod_GET_SELF(__pyx_t_1);
+          if (likely(__pyx_t_19)) {
+            PyObject* function = PyMethod_GET_FUNCTION(__pyx_t_1);
+            __Pyx_INCREF(__pyx_t_19);
+            __Pyx_INCREF(function);
+            __Pyx_DECREF_SET(__pyx_t_1, function);
+            __pyx_t_21 = 1;
+          }
+        }
+        #if CYTHON_FAST_PYCALL
+        if (PyFunction_Check(__pyx_t_1)) {
+          PyObject *__pyx_temp[3] = {__pyx_t_19, __pyx_t_2, __pyx_t_31};
+          __pyx_t_20 = __Pyx_PyFunction_FastCall(__pyx_t_1, __pyx_temp+1-__pyx_t_21, 2+__pyx_t_21); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 80, __pyx_L1_error)
+          __Pyx_XDECREF(__pyx_t_19); __pyx_t_19 = 0;
+          __Pyx_GOTREF(__pyx_t_20);
+          __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+          __Pyx_DECREF(__pyx_t_31); __pyx_t_31 = 0;
+        } else
+        #endif
+        #if CYTHON_FAST_PYCCALL
+        if (__Pyx_PyFastCFunction_Check(__pyx_t_1)) {
+          PyObject *__pyx_temp[3] = {__pyx_t_19, __pyx_t_2, __pyx_t_31};
+          __pyx_t_20 = __Pyx_PyCFunction_FastCall(__pyx_t_1, __pyx_temp+1-__pyx_t_21, 2+__pyx_t_21); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 80, __pyx_L1_error)
+          __Pyx_XDECREF(__pyx_t_19); __pyx_t_19 = 0;
+          __Pyx_GOTREF(__pyx_t_20);
+          __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+          __Pyx_DECREF(__pyx_t_31); __pyx_t_31 = 0;
+        } else
+        #endif
+        {
+          __pyx_t_32 = PyTuple_New(2+__pyx_t_21); if (unlikely(!__pyx_t_32)) __PYX_ERR(0, 80, __pyx_L1_error)
+          __Pyx_GOTREF(__pyx_t_32);
+          if (__pyx_t_19) {
+            __Pyx_GIVEREF(__pyx_t_19); PyTuple_SET_ITEM(__pyx_t_32, 0, __pyx_t_19); __pyx_t_19 = NULL;
+          }
+          __Pyx_GIVEREF(__pyx_t_2);
+          PyTuple_SET_ITEM(__pyx_t_32, 0+__pyx_t_21, __pyx_t_2);
+          __Pyx_GIVEREF(__pyx_t_31);
+          PyTuple_SET_ITEM(__pyx_t_32, 1+__pyx_t_21, __pyx_t_31);
+          __pyx_t_2 = 0;
+          __pyx_t_31 = 0;
+          __pyx_t_20 = __Pyx_PyObject_Call(__pyx_t_1, __pyx_t_32, NULL); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 80, __pyx_L1_error)
+          __Pyx_GOTREF(__pyx_t_20);
+          __Pyx_DECREF(__pyx_t_32); __pyx_t_32 = 0;
+        }
+        __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+        if (likely(PyList_CheckExact(__pyx_t_20)) || PyTuple_CheckExact(__pyx_t_20)) {
+          __pyx_t_1 = __pyx_t_20; __Pyx_INCREF(__pyx_t_1); __pyx_t_33 = 0;
+          __pyx_t_34 = NULL;
+        } else {
+          __pyx_t_33 = -1; __pyx_t_1 = PyObject_GetIter(__pyx_t_20); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 80, __pyx_L1_error)
+          __Pyx_GOTREF(__pyx_t_1);
+          __pyx_t_34 = Py_TYPE(__pyx_t_1)->tp_iternext; if (unlikely(!__pyx_t_34)) __PYX_ERR(0, 80, __pyx_L1_error)
+        }
+        __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+        for (;;) {
+          if (likely(!__pyx_t_34)) {
+            if (likely(PyList_CheckExact(__pyx_t_1))) {
+              if (__pyx_t_33 >= PyList_GET_SIZE(__pyx_t_1)) break;
+              #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+              __pyx_t_20 = PyList_GET_ITEM(__pyx_t_1, __pyx_t_33); __Pyx_INCREF(__pyx_t_20); __pyx_t_33++; if (unlikely(0 < 0)) __PYX_ERR(0, 80, __pyx_L1_error)
+              #else
+              __pyx_t_20 = PySequence_ITEM(__pyx_t_1, __pyx_t_33); __pyx_t_33++; if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 80, __pyx_L1_error)
+              __Pyx_GOTREF(__pyx_t_20);
+              #endif
+            } else {
+              if (__pyx_t_33 >= PyTuple_GET_SIZE(__pyx_t_1)) break;
+              #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+              __pyx_t_20 = PyTuple_GET_ITEM(__pyx_t_1, __pyx_t_33); __Pyx_INCREF(__pyx_t_20); __pyx_t_33++; if (unlikely(0 < 0)) __PYX_ERR(0, 80, __pyx_L1_error)
+              #else
+              __pyx_t_20 = PySequence_ITEM(__pyx_t_1, __pyx_t_33); __pyx_t_33++; if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 80, __pyx_L1_error)
+              __Pyx_GOTREF(__pyx_t_20);
+              #endif
+            }
+          } else {
+            __pyx_t_20 = __pyx_t_34(__pyx_t_1);
+            if (unlikely(!__pyx_t_20)) {
+              PyObject* exc_type = PyErr_Occurred();
+              if (exc_type) {
+                if (likely(__Pyx_PyErr_GivenExceptionMatches(exc_type, PyExc_StopIteration))) PyErr_Clear();
+                else __PYX_ERR(0, 80, __pyx_L1_error)
+              }
+              break;
+            }
+            __Pyx_GOTREF(__pyx_t_20);
+          }
+          if ((likely(PyTuple_CheckExact(__pyx_t_20))) || (PyList_CheckExact(__pyx_t_20))) {
+            PyObject* sequence = __pyx_t_20;
+            Py_ssize_t size = __Pyx_PySequence_SIZE(sequence);
+            if (unlikely(size != 2)) {
+              if (size > 2) __Pyx_RaiseTooManyValuesError(2);
+              else if (size >= 0) __Pyx_RaiseNeedMoreValuesError(size);
+              __PYX_ERR(0, 80, __pyx_L1_error)
+            }
+            #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+            if (likely(PyTuple_CheckExact(sequence))) {
+              __pyx_t_32 = PyTuple_GET_ITEM(sequence, 0); 
+              __pyx_t_31 = PyTuple_GET_ITEM(sequence, 1); 
+            } else {
+              __pyx_t_32 = PyList_GET_ITEM(sequence, 0); 
+              __pyx_t_31 = PyList_GET_ITEM(sequence, 1); 
+            }
+            __Pyx_INCREF(__pyx_t_32);
+            __Pyx_INCREF(__pyx_t_31);
+            #else
+            __pyx_t_32 = PySequence_ITEM(sequence, 0); if (unlikely(!__pyx_t_32)) __PYX_ERR(0, 80, __pyx_L1_error)
+            __Pyx_GOTREF(__pyx_t_32);
+            __pyx_t_31 = PySequence_ITEM(sequence, 1); if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 80, __pyx_L1_error)
+            __Pyx_GOTREF(__pyx_t_31);
+            #endif
+            __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+          } else {
+            Py_ssize_t index = -1;
+            __pyx_t_2 = PyObject_GetIter(__pyx_t_20); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 80, __pyx_L1_error)
+            __Pyx_GOTREF(__pyx_t_2);
+            __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+            __pyx_t_28 = Py_TYPE(__pyx_t_2)->tp_iternext;
+            index = 0; __pyx_t_32 = __pyx_t_28(__pyx_t_2); if (unlikely(!__pyx_t_32)) goto __pyx_L15_unpacking_failed;
+            __Pyx_GOTREF(__pyx_t_32);
+            index = 1; __pyx_t_31 = __pyx_t_28(__pyx_t_2); if (unlikely(!__pyx_t_31)) goto __pyx_L15_unpacking_failed;
+            __Pyx_GOTREF(__pyx_t_31);
+            if (__Pyx_IternextUnpackEndCheck(__pyx_t_28(__pyx_t_2), 2) < 0) __PYX_ERR(0, 80, __pyx_L1_error)
+            __pyx_t_28 = NULL;
+            __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+            goto __pyx_L16_unpacking_done;
+            __pyx_L15_unpacking_failed:;
+            __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+            __pyx_t_28 = NULL;
+            if (__Pyx_IterFinish() == 0) __Pyx_RaiseNeedMoreValuesError(index);
+            __PYX_ERR(0, 80, __pyx_L1_error)
+            __pyx_L16_unpacking_done:;
+          }
+          __pyx_t_14 = __Pyx_PyInt_As_npy_int64(__pyx_t_32); if (unlikely((__pyx_t_14 == ((npy_int64)-1)) && PyErr_Occurred())) __PYX_ERR(0, 80, __pyx_L1_error)
+          __Pyx_DECREF(__pyx_t_32); __pyx_t_32 = 0;
+          __pyx_t_15 = __Pyx_PyInt_As_npy_int64(__pyx_t_31); if (unlikely((__pyx_t_15 == ((npy_int64)-1)) && PyErr_Occurred())) __PYX_ERR(0, 80, __pyx_L1_error)
+          __Pyx_DECREF(__pyx_t_31); __pyx_t_31 = 0;
+          __pyx_v_a = __pyx_t_14;
+          __pyx_v_ap = __pyx_t_15;
+
+          /* "qmeq/approach/elph/c_redfield.pyx":81
+ *                 # --------------------------------------------------
+ *                 for a, ap in itertools.product(si.statesdm[charge], si.statesdm[charge]):
+ *                     aap = mapdm0[lenlst[charge]*dictdm[a] + dictdm[ap] + shiftlst0[charge]]             # <<<<<<<<<<<<<<
+ *                     if aap != -1:
+ *                         bpap = mapdm0_[lenlst[charge]*dictdm[bp] + dictdm[ap] + shiftlst0[charge]]
+ */
+          __pyx_t_29 = __pyx_v_charge;
+          if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+          __pyx_t_15 = __pyx_v_a;
+          if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+          __pyx_t_14 = __pyx_v_ap;
+          if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+          __pyx_t_30 = __pyx_v_charge;
+          if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+          __pyx_t_13 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_15, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_14, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+          if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_mapdm0.diminfo[0].shape;
+          __pyx_v_aap = (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_mapdm0.rcbuffer->pybuffer.buf, __pyx_t_13, __pyx_pybuffernd_mapdm0.diminfo[0].strides));
+
+          /* "qmeq/approach/elph/c_redfield.pyx":82
+ *                 for a, ap in itertools.product(si.statesdm[charge], si.statesdm[charge]):
+ *                     aap = mapdm0[lenlst[charge]*dictdm[a] + dictdm[ap] + shiftlst0[charge]]
+ *                     if aap != -1:             # <<<<<<<<<<<<<<
+ *                         bpap = mapdm0_[lenlst[charge]*dictdm[bp] + dictdm[ap] + shiftlst0[charge]]
+ *                         ba = mapdm0_[lenlst[charge]*dictdm[b] + dictdm[a] + shiftlst0[charge]]
+ */
+          __pyx_t_18 = ((__pyx_v_aap != -1LL) != 0);
+          if (__pyx_t_18) {
+
+            /* "qmeq/approach/elph/c_redfield.pyx":83
+ *                     aap = mapdm0[lenlst[charge]*dictdm[a] + dictdm[ap] + shiftlst0[charge]]
+ *                     if aap != -1:
+ *                         bpap = mapdm0_[lenlst[charge]*dictdm[bp] + dictdm[ap] + shiftlst0[charge]]             # <<<<<<<<<<<<<<
+ *                         ba = mapdm0_[lenlst[charge]*dictdm[b] + dictdm[a] + shiftlst0[charge]]
+ *                         fct_aap = 0
+ */
+            __pyx_t_30 = __pyx_v_charge;
+            if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+            __pyx_t_14 = __pyx_v_bp;
+            if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_15 = __pyx_v_ap;
+            if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_29 = __pyx_v_charge;
+            if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+            __pyx_t_13 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_14, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_15, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+            if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_mapdm0_.diminfo[0].shape;
+            __pyx_v_bpap = (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_mapdm0_.rcbuffer->pybuffer.buf, __pyx_t_13, __pyx_pybuffernd_mapdm0_.diminfo[0].strides));
+
+            /* "qmeq/approach/elph/c_redfield.pyx":84
+ *                     if aap != -1:
+ *                         bpap = mapdm0_[lenlst[charge]*dictdm[bp] + dictdm[ap] + shiftlst0[charge]]
+ *                         ba = mapdm0_[lenlst[charge]*dictdm[b] + dictdm[a] + shiftlst0[charge]]             # <<<<<<<<<<<<<<
+ *                         fct_aap = 0
+ *                         for l in range(nbaths):
+ */
+            __pyx_t_29 = __pyx_v_charge;
+            if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+            __pyx_t_15 = __pyx_v_b;
+            if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_14 = __pyx_v_a;
+            if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_30 = __pyx_v_charge;
+            if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+            __pyx_t_13 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_15, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_14, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+            if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_mapdm0_.diminfo[0].shape;
+            __pyx_v_ba = (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_mapdm0_.rcbuffer->pybuffer.buf, __pyx_t_13, __pyx_pybuffernd_mapdm0_.diminfo[0].strides));
+
+            /* "qmeq/approach/elph/c_redfield.pyx":85
+ *                         bpap = mapdm0_[lenlst[charge]*dictdm[bp] + dictdm[ap] + shiftlst0[charge]]
+ *                         ba = mapdm0_[lenlst[charge]*dictdm[b] + dictdm[a] + shiftlst0[charge]]
+ *                         fct_aap = 0             # <<<<<<<<<<<<<<
+ *                         for l in range(nbaths):
+ *                             gamma_ba_bpap = 0.5*(Vbbp[l, b, a]*Vbbp[l, bp, ap].conjugate() +
+ */
+            __pyx_v_fct_aap = __pyx_t_double_complex_from_parts(0, 0);
+
+            /* "qmeq/approach/elph/c_redfield.pyx":86
+ *                         ba = mapdm0_[lenlst[charge]*dictdm[b] + dictdm[a] + shiftlst0[charge]]
+ *                         fct_aap = 0
+ *                         for l in range(nbaths):             # <<<<<<<<<<<<<<
+ *                             gamma_ba_bpap = 0.5*(Vbbp[l, b, a]*Vbbp[l, bp, ap].conjugate() +
+ *                                                  Vbbp[l, a, b].conjugate()*Vbbp[l, ap, bp])
+ */
+            __pyx_t_35 = __pyx_v_nbaths;
+            __pyx_t_36 = __pyx_t_35;
+            for (__pyx_t_37 = 0; __pyx_t_37 < __pyx_t_36; __pyx_t_37+=1) {
+              __pyx_v_l = __pyx_t_37;
+
+              /* "qmeq/approach/elph/c_redfield.pyx":87
+ *                         fct_aap = 0
+ *                         for l in range(nbaths):
+ *                             gamma_ba_bpap = 0.5*(Vbbp[l, b, a]*Vbbp[l, bp, ap].conjugate() +             # <<<<<<<<<<<<<<
+ *                                                  Vbbp[l, a, b].conjugate()*Vbbp[l, ap, bp])
+ *                             fct_aap += gamma_ba_bpap*(w1fct[l, bpap, 0].conjugate() - w1fct[l, ba, 0])
+ */
+              __pyx_t_30 = __pyx_v_l;
+              __pyx_t_14 = __pyx_v_b;
+              __pyx_t_15 = __pyx_v_a;
+              if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+              if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+              if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+              __pyx_t_29 = __pyx_v_l;
+              __pyx_t_13 = __pyx_v_bp;
+              __pyx_t_38 = __pyx_v_ap;
+              if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+              if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+              if (__pyx_t_38 < 0) __pyx_t_38 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+
+              /* "qmeq/approach/elph/c_redfield.pyx":88
+ *                         for l in range(nbaths):
+ *                             gamma_ba_bpap = 0.5*(Vbbp[l, b, a]*Vbbp[l, bp, ap].conjugate() +
+ *                                                  Vbbp[l, a, b].conjugate()*Vbbp[l, ap, bp])             # <<<<<<<<<<<<<<
+ *                             fct_aap += gamma_ba_bpap*(w1fct[l, bpap, 0].conjugate() - w1fct[l, ba, 0])
+ *                         aapi = ndm0 + aap - npauli
+ */
+              __pyx_t_39 = __pyx_v_l;
+              __pyx_t_40 = __pyx_v_a;
+              __pyx_t_41 = __pyx_v_b;
+              if (__pyx_t_39 < 0) __pyx_t_39 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+              if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+              if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+              __pyx_t_42 = __pyx_v_l;
+              __pyx_t_43 = __pyx_v_ap;
+              __pyx_t_44 = __pyx_v_bp;
+              if (__pyx_t_42 < 0) __pyx_t_42 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+              if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+              if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+
+              /* "qmeq/approach/elph/c_redfield.pyx":87
+ *                         fct_aap = 0
+ *                         for l in range(nbaths):
+ *                             gamma_ba_bpap = 0.5*(Vbbp[l, b, a]*Vbbp[l, bp, ap].conjugate() +             # <<<<<<<<<<<<<<
+ *                                                  Vbbp[l, a, b].conjugate()*Vbbp[l, ap, bp])
+ *                             fct_aap += gamma_ba_bpap*(w1fct[l, bpap, 0].conjugate() - w1fct[l, ba, 0])
+ */
+              __pyx_v_gamma_ba_bpap = __Pyx_c_prod_double(__pyx_t_double_complex_from_parts(0.5, 0), __Pyx_c_sum_double(__Pyx_c_prod_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_14, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_15, __pyx_pybuffernd_Vbbp.diminfo[2].strides)), __Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_13, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_38, __pyx_pybuffernd_Vbbp.diminfo[2].strides)))), __Pyx_c_prod_double(__Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_39, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_40, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_41, __pyx_pybuffernd_Vbbp.diminfo[2].strides))), (*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_42, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_43, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_44, __pyx_pybuffernd_Vbbp.diminfo[2].strides)))));
+
+              /* "qmeq/approach/elph/c_redfield.pyx":89
+ *                             gamma_ba_bpap = 0.5*(Vbbp[l, b, a]*Vbbp[l, bp, ap].conjugate() +
+ *                                                  Vbbp[l, a, b].conjugate()*Vbbp[l, ap, bp])
+ *                             fct_aap += gamma_ba_bpap*(w1fct[l, bpap, 0].conjugate() - w1fct[l, ba, 0])             # <<<<<<<<<<<<<<
+ *                         aapi = ndm0 + aap - npauli
+ *                         aap_sgn = +1 if conjdm0[lenlst[charge]*dictdm[a] + dictdm[ap] + shiftlst0[charge]] else -1
+ */
+              __pyx_t_42 = __pyx_v_l;
+              __pyx_t_44 = __pyx_v_bpap;
+              __pyx_t_39 = 0;
+              if (__pyx_t_42 < 0) __pyx_t_42 += __pyx_pybuffernd_w1fct.diminfo[0].shape;
+              if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_w1fct.diminfo[1].shape;
+              if (__pyx_t_39 < 0) __pyx_t_39 += __pyx_pybuffernd_w1fct.diminfo[2].shape;
+              __pyx_t_29 = __pyx_v_l;
+              __pyx_t_43 = __pyx_v_ba;
+              __pyx_t_30 = 0;
+              if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_w1fct.diminfo[0].shape;
+              if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_w1fct.diminfo[1].shape;
+              if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_w1fct.diminfo[2].shape;
+              __pyx_v_fct_aap = __Pyx_c_sum_double(__pyx_v_fct_aap, __Pyx_c_prod_double(__pyx_v_gamma_ba_bpap, __Pyx_c_diff_double(__Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_w1fct.rcbuffer->pybuffer.buf, __pyx_t_42, __pyx_pybuffernd_w1fct.diminfo[0].strides, __pyx_t_44, __pyx_pybuffernd_w1fct.diminfo[1].strides, __pyx_t_39, __pyx_pybuffernd_w1fct.diminfo[2].strides))), (*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_w1fct.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_w1fct.diminfo[0].strides, __pyx_t_43, __pyx_pybuffernd_w1fct.diminfo[1].strides, __pyx_t_30, __pyx_pybuffernd_w1fct.diminfo[2].strides)))));
+            }
+
+            /* "qmeq/approach/elph/c_redfield.pyx":90
+ *                                                  Vbbp[l, a, b].conjugate()*Vbbp[l, ap, bp])
+ *                             fct_aap += gamma_ba_bpap*(w1fct[l, bpap, 0].conjugate() - w1fct[l, ba, 0])
+ *                         aapi = ndm0 + aap - npauli             # <<<<<<<<<<<<<<
+ *                         aap_sgn = +1 if conjdm0[lenlst[charge]*dictdm[a] + dictdm[ap] + shiftlst0[charge]] else -1
+ *                         kern[bbp, aap] = kern[bbp, aap] + fct_aap.imag
+ */
+            __pyx_v_aapi = ((__pyx_v_ndm0 + __pyx_v_aap) - __pyx_v_npauli);
+
+            /* "qmeq/approach/elph/c_redfield.pyx":91
+ *                             fct_aap += gamma_ba_bpap*(w1fct[l, bpap, 0].conjugate() - w1fct[l, ba, 0])
+ *                         aapi = ndm0 + aap - npauli
+ *                         aap_sgn = +1 if conjdm0[lenlst[charge]*dictdm[a] + dictdm[ap] + shiftlst0[charge]] else -1             # <<<<<<<<<<<<<<
+ *                         kern[bbp, aap] = kern[bbp, aap] + fct_aap.imag
+ *                         if aapi >= ndm0:
+ */
+            __pyx_t_30 = __pyx_v_charge;
+            if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+            __pyx_t_43 = __pyx_v_a;
+            if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_44 = __pyx_v_ap;
+            if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_29 = __pyx_v_charge;
+            if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+            __pyx_t_41 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+            if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_conjdm0.diminfo[0].shape;
+            if (((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_bool_t *, __pyx_pybuffernd_conjdm0.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_conjdm0.diminfo[0].strides)) != 0)) {
+              __pyx_t_35 = 1;
+            } else {
+              __pyx_t_35 = -1L;
+            }
+            __pyx_v_aap_sgn = __pyx_t_35;
+
+            /* "qmeq/approach/elph/c_redfield.pyx":92
+ *                         aapi = ndm0 + aap - npauli
+ *                         aap_sgn = +1 if conjdm0[lenlst[charge]*dictdm[a] + dictdm[ap] + shiftlst0[charge]] else -1
+ *                         kern[bbp, aap] = kern[bbp, aap] + fct_aap.imag             # <<<<<<<<<<<<<<
+ *                         if aapi >= ndm0:
+ *                             kern[bbp, aapi] = kern[bbp, aapi] + fct_aap.real*aap_sgn
+ */
+            __pyx_t_44 = __pyx_v_bbp;
+            __pyx_t_43 = __pyx_v_aap;
+            if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_kern.diminfo[0].shape;
+            if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_kern.diminfo[1].shape;
+            __pyx_t_41 = __pyx_v_bbp;
+            __pyx_t_40 = __pyx_v_aap;
+            if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_kern.diminfo[0].shape;
+            if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_kern.diminfo[1].shape;
+            *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_40, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_43, __pyx_pybuffernd_kern.diminfo[1].strides)) + __Pyx_CIMAG(__pyx_v_fct_aap));
+
+            /* "qmeq/approach/elph/c_redfield.pyx":93
+ *                         aap_sgn = +1 if conjdm0[lenlst[charge]*dictdm[a] + dictdm[ap] + shiftlst0[charge]] else -1
+ *                         kern[bbp, aap] = kern[bbp, aap] + fct_aap.imag
+ *                         if aapi >= ndm0:             # <<<<<<<<<<<<<<
+ *                             kern[bbp, aapi] = kern[bbp, aapi] + fct_aap.real*aap_sgn
+ *                             if bbpi_bool:
+ */
+            __pyx_t_18 = ((__pyx_v_aapi >= __pyx_v_ndm0) != 0);
+            if (__pyx_t_18) {
+
+              /* "qmeq/approach/elph/c_redfield.pyx":94
+ *                         kern[bbp, aap] = kern[bbp, aap] + fct_aap.imag
+ *                         if aapi >= ndm0:
+ *                             kern[bbp, aapi] = kern[bbp, aapi] + fct_aap.real*aap_sgn             # <<<<<<<<<<<<<<
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, aapi] = kern[bbpi, aapi] + fct_aap.imag*aap_sgn
+ */
+              __pyx_t_43 = __pyx_v_bbp;
+              __pyx_t_44 = __pyx_v_aapi;
+              if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              __pyx_t_40 = __pyx_v_bbp;
+              __pyx_t_41 = __pyx_v_aapi;
+              if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_40, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_41, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_44, __pyx_pybuffernd_kern.diminfo[1].strides)) + (__Pyx_CREAL(__pyx_v_fct_aap) * __pyx_v_aap_sgn));
+
+              /* "qmeq/approach/elph/c_redfield.pyx":95
+ *                         if aapi >= ndm0:
+ *                             kern[bbp, aapi] = kern[bbp, aapi] + fct_aap.real*aap_sgn
+ *                             if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                                 kern[bbpi, aapi] = kern[bbpi, aapi] + fct_aap.imag*aap_sgn
+ *                         if bbpi_bool:
+ */
+              __pyx_t_18 = (__pyx_v_bbpi_bool != 0);
+              if (__pyx_t_18) {
+
+                /* "qmeq/approach/elph/c_redfield.pyx":96
+ *                             kern[bbp, aapi] = kern[bbp, aapi] + fct_aap.real*aap_sgn
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, aapi] = kern[bbpi, aapi] + fct_aap.imag*aap_sgn             # <<<<<<<<<<<<<<
+ *                         if bbpi_bool:
+ *                             kern[bbpi, aap] = kern[bbpi, aap] - fct_aap.real
+ */
+                __pyx_t_44 = __pyx_v_bbpi;
+                __pyx_t_43 = __pyx_v_aapi;
+                if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_kern.diminfo[0].shape;
+                if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_kern.diminfo[1].shape;
+                __pyx_t_41 = __pyx_v_bbpi;
+                __pyx_t_40 = __pyx_v_aapi;
+                if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_kern.diminfo[0].shape;
+                if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_kern.diminfo[1].shape;
+                *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_40, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_43, __pyx_pybuffernd_kern.diminfo[1].strides)) + (__Pyx_CIMAG(__pyx_v_fct_aap) * __pyx_v_aap_sgn));
+
+                /* "qmeq/approach/elph/c_redfield.pyx":95
+ *                         if aapi >= ndm0:
+ *                             kern[bbp, aapi] = kern[bbp, aapi] + fct_aap.real*aap_sgn
+ *                             if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                                 kern[bbpi, aapi] = kern[bbpi, aapi] + fct_aap.imag*aap_sgn
+ *                         if bbpi_bool:
+ */
+              }
+
+              /* "qmeq/approach/elph/c_redfield.pyx":93
+ *                         aap_sgn = +1 if conjdm0[lenlst[charge]*dictdm[a] + dictdm[ap] + shiftlst0[charge]] else -1
+ *                         kern[bbp, aap] = kern[bbp, aap] + fct_aap.imag
+ *                         if aapi >= ndm0:             # <<<<<<<<<<<<<<
+ *                             kern[bbp, aapi] = kern[bbp, aapi] + fct_aap.real*aap_sgn
+ *                             if bbpi_bool:
+ */
+            }
+
+            /* "qmeq/approach/elph/c_redfield.pyx":97
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, aapi] = kern[bbpi, aapi] + fct_aap.imag*aap_sgn
+ *                         if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                             kern[bbpi, aap] = kern[bbpi, aap] - fct_aap.real
+ *                 # --------------------------------------------------
+ */
+            __pyx_t_18 = (__pyx_v_bbpi_bool != 0);
+            if (__pyx_t_18) {
+
+              /* "qmeq/approach/elph/c_redfield.pyx":98
+ *                                 kern[bbpi, aapi] = kern[bbpi, aapi] + fct_aap.imag*aap_sgn
+ *                         if bbpi_bool:
+ *                             kern[bbpi, aap] = kern[bbpi, aap] - fct_aap.real             # <<<<<<<<<<<<<<
+ *                 # --------------------------------------------------
+ *                 for bpp in si.statesdm[charge]:
+ */
+              __pyx_t_43 = __pyx_v_bbpi;
+              __pyx_t_44 = __pyx_v_aap;
+              if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              __pyx_t_40 = __pyx_v_bbpi;
+              __pyx_t_41 = __pyx_v_aap;
+              if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_40, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_41, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_44, __pyx_pybuffernd_kern.diminfo[1].strides)) - __Pyx_CREAL(__pyx_v_fct_aap));
+
+              /* "qmeq/approach/elph/c_redfield.pyx":97
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, aapi] = kern[bbpi, aapi] + fct_aap.imag*aap_sgn
+ *                         if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                             kern[bbpi, aap] = kern[bbpi, aap] - fct_aap.real
+ *                 # --------------------------------------------------
+ */
+            }
+
+            /* "qmeq/approach/elph/c_redfield.pyx":82
+ *                 for a, ap in itertools.product(si.statesdm[charge], si.statesdm[charge]):
+ *                     aap = mapdm0[lenlst[charge]*dictdm[a] + dictdm[ap] + shiftlst0[charge]]
+ *                     if aap != -1:             # <<<<<<<<<<<<<<
+ *                         bpap = mapdm0_[lenlst[charge]*dictdm[bp] + dictdm[ap] + shiftlst0[charge]]
+ *                         ba = mapdm0_[lenlst[charge]*dictdm[b] + dictdm[a] + shiftlst0[charge]]
+ */
+          }
+
+          /* "qmeq/approach/elph/c_redfield.pyx":80
+ *                 bbpi_bool = True if bbpi >= ndm0 else False
+ *                 # --------------------------------------------------
+ *                 for a, ap in itertools.product(si.statesdm[charge], si.statesdm[charge]):             # <<<<<<<<<<<<<<
+ *                     aap = mapdm0[lenlst[charge]*dictdm[a] + dictdm[ap] + shiftlst0[charge]]
+ *                     if aap != -1:
+ */
+        }
+        __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+
+        /* "qmeq/approach/elph/c_redfield.pyx":100
+ *                             kern[bbpi, aap] = kern[bbpi, aap] - fct_aap.real
+ *                 # --------------------------------------------------
+ *                 for bpp in si.statesdm[charge]:             # <<<<<<<<<<<<<<
+ *                     bppbp = mapdm0[lenlst[charge]*dictdm[bpp] + dictdm[bp] + shiftlst0[charge]]
+ *                     if bppbp != -1:
+ */
+        __pyx_t_1 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_statesdm); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 100, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_1);
+        __pyx_t_20 = __Pyx_GetItemInt(__pyx_t_1, __pyx_v_charge, __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t, 1, __Pyx_PyInt_From_npy_long, 0, 1, 0); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 100, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_20);
+        __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+        if (likely(PyList_CheckExact(__pyx_t_20)) || PyTuple_CheckExact(__pyx_t_20)) {
+          __pyx_t_1 = __pyx_t_20; __Pyx_INCREF(__pyx_t_1); __pyx_t_33 = 0;
+          __pyx_t_34 = NULL;
+        } else {
+          __pyx_t_33 = -1; __pyx_t_1 = PyObject_GetIter(__pyx_t_20); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 100, __pyx_L1_error)
+          __Pyx_GOTREF(__pyx_t_1);
+          __pyx_t_34 = Py_TYPE(__pyx_t_1)->tp_iternext; if (unlikely(!__pyx_t_34)) __PYX_ERR(0, 100, __pyx_L1_error)
+        }
+        __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+        for (;;) {
+          if (likely(!__pyx_t_34)) {
+            if (likely(PyList_CheckExact(__pyx_t_1))) {
+              if (__pyx_t_33 >= PyList_GET_SIZE(__pyx_t_1)) break;
+              #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+              __pyx_t_20 = PyList_GET_ITEM(__pyx_t_1, __pyx_t_33); __Pyx_INCREF(__pyx_t_20); __pyx_t_33++; if (unlikely(0 < 0)) __PYX_ERR(0, 100, __pyx_L1_error)
+              #else
+              __pyx_t_20 = PySequence_ITEM(__pyx_t_1, __pyx_t_33); __pyx_t_33++; if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 100, __pyx_L1_error)
+              __Pyx_GOTREF(__pyx_t_20);
+              #endif
+            } else {
+              if (__pyx_t_33 >= PyTuple_GET_SIZE(__pyx_t_1)) break;
+              #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+              __pyx_t_20 = PyTuple_GET_ITEM(__pyx_t_1, __pyx_t_33); __Pyx_INCREF(__pyx_t_20); __pyx_t_33++; if (unlikely(0 < 0)) __PYX_ERR(0, 100, __pyx_L1_error)
+              #else
+              __pyx_t_20 = PySequence_ITEM(__pyx_t_1, __pyx_t_33); __pyx_t_33++; if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 100, __pyx_L1_error)
+              __Pyx_GOTREF(__pyx_t_20);
+              #endif
+            }
+          } else {
+            __pyx_t_20 = __pyx_t_34(__pyx_t_1);
+            if (unlikely(!__pyx_t_20)) {
+              PyObject* exc_type = PyErr_Occurred();
+              if (exc_type) {
+                if (likely(__Pyx_PyErr_GivenExceptionMatches(exc_type, PyExc_StopIteration))) PyErr_Clear();
+                else __PYX_ERR(0, 100, __pyx_L1_error)
+              }
+              break;
+            }
+            __Pyx_GOTREF(__pyx_t_20);
+          }
+          __pyx_t_44 = __Pyx_PyInt_As_npy_int64(__pyx_t_20); if (unlikely((__pyx_t_44 == ((npy_int64)-1)) && PyErr_Occurred())) __PYX_ERR(0, 100, __pyx_L1_error)
+          __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+          __pyx_v_bpp = __pyx_t_44;
+
+          /* "qmeq/approach/elph/c_redfield.pyx":101
+ *                 # --------------------------------------------------
+ *                 for bpp in si.statesdm[charge]:
+ *                     bppbp = mapdm0[lenlst[charge]*dictdm[bpp] + dictdm[bp] + shiftlst0[charge]]             # <<<<<<<<<<<<<<
+ *                     if bppbp != -1:
+ *                         fct_bppbp = 0
+ */
+          __pyx_t_29 = __pyx_v_charge;
+          if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+          __pyx_t_44 = __pyx_v_bpp;
+          if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+          __pyx_t_43 = __pyx_v_bp;
+          if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+          __pyx_t_30 = __pyx_v_charge;
+          if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+          __pyx_t_41 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+          if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_mapdm0.diminfo[0].shape;
+          __pyx_v_bppbp = (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_mapdm0.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_mapdm0.diminfo[0].strides));
+
+          /* "qmeq/approach/elph/c_redfield.pyx":102
+ *                 for bpp in si.statesdm[charge]:
+ *                     bppbp = mapdm0[lenlst[charge]*dictdm[bpp] + dictdm[bp] + shiftlst0[charge]]
+ *                     if bppbp != -1:             # <<<<<<<<<<<<<<
+ *                         fct_bppbp = 0
+ *                         for a in si.statesdm[charge]:
+ */
+          __pyx_t_18 = ((__pyx_v_bppbp != -1LL) != 0);
+          if (__pyx_t_18) {
+
+            /* "qmeq/approach/elph/c_redfield.pyx":103
+ *                     bppbp = mapdm0[lenlst[charge]*dictdm[bpp] + dictdm[bp] + shiftlst0[charge]]
+ *                     if bppbp != -1:
+ *                         fct_bppbp = 0             # <<<<<<<<<<<<<<
+ *                         for a in si.statesdm[charge]:
+ *                             bppa = mapdm0_[lenlst[charge]*dictdm[bpp] + dictdm[a] + shiftlst0[charge]]
+ */
+            __pyx_v_fct_bppbp = __pyx_t_double_complex_from_parts(0, 0);
+
+            /* "qmeq/approach/elph/c_redfield.pyx":104
+ *                     if bppbp != -1:
+ *                         fct_bppbp = 0
+ *                         for a in si.statesdm[charge]:             # <<<<<<<<<<<<<<
+ *                             bppa = mapdm0_[lenlst[charge]*dictdm[bpp] + dictdm[a] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ */
+            __pyx_t_20 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_statesdm); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 104, __pyx_L1_error)
+            __Pyx_GOTREF(__pyx_t_20);
+            __pyx_t_31 = __Pyx_GetItemInt(__pyx_t_20, __pyx_v_charge, __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t, 1, __Pyx_PyInt_From_npy_long, 0, 1, 0); if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 104, __pyx_L1_error)
+            __Pyx_GOTREF(__pyx_t_31);
+            __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+            if (likely(PyList_CheckExact(__pyx_t_31)) || PyTuple_CheckExact(__pyx_t_31)) {
+              __pyx_t_20 = __pyx_t_31; __Pyx_INCREF(__pyx_t_20); __pyx_t_45 = 0;
+              __pyx_t_46 = NULL;
+            } else {
+              __pyx_t_45 = -1; __pyx_t_20 = PyObject_GetIter(__pyx_t_31); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 104, __pyx_L1_error)
+              __Pyx_GOTREF(__pyx_t_20);
+              __pyx_t_46 = Py_TYPE(__pyx_t_20)->tp_iternext; if (unlikely(!__pyx_t_46)) __PYX_ERR(0, 104, __pyx_L1_error)
+            }
+            __Pyx_DECREF(__pyx_t_31); __pyx_t_31 = 0;
+            for (;;) {
+              if (likely(!__pyx_t_46)) {
+                if (likely(PyList_CheckExact(__pyx_t_20))) {
+                  if (__pyx_t_45 >= PyList_GET_SIZE(__pyx_t_20)) break;
+                  #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+                  __pyx_t_31 = PyList_GET_ITEM(__pyx_t_20, __pyx_t_45); __Pyx_INCREF(__pyx_t_31); __pyx_t_45++; if (unlikely(0 < 0)) __PYX_ERR(0, 104, __pyx_L1_error)
+                  #else
+                  __pyx_t_31 = PySequence_ITEM(__pyx_t_20, __pyx_t_45); __pyx_t_45++; if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 104, __pyx_L1_error)
+                  __Pyx_GOTREF(__pyx_t_31);
+                  #endif
+                } else {
+                  if (__pyx_t_45 >= PyTuple_GET_SIZE(__pyx_t_20)) break;
+                  #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+                  __pyx_t_31 = PyTuple_GET_ITEM(__pyx_t_20, __pyx_t_45); __Pyx_INCREF(__pyx_t_31); __pyx_t_45++; if (unlikely(0 < 0)) __PYX_ERR(0, 104, __pyx_L1_error)
+                  #else
+                  __pyx_t_31 = PySequence_ITEM(__pyx_t_20, __pyx_t_45); __pyx_t_45++; if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 104, __pyx_L1_error)
+                  __Pyx_GOTREF(__pyx_t_31);
+                  #endif
+                }
+              } else {
+                __pyx_t_31 = __pyx_t_46(__pyx_t_20);
+                if (unlikely(!__pyx_t_31)) {
+                  PyObject* exc_type = PyErr_Occurred();
+                  if (exc_type) {
+                    if (likely(__Pyx_PyErr_GivenExceptionMatches(exc_type, PyExc_StopIteration))) PyErr_Clear();
+                    else __PYX_ERR(0, 104, __pyx_L1_error)
+                  }
+                  break;
+                }
+                __Pyx_GOTREF(__pyx_t_31);
+              }
+              __pyx_t_43 = __Pyx_PyInt_As_npy_int64(__pyx_t_31); if (unlikely((__pyx_t_43 == ((npy_int64)-1)) && PyErr_Occurred())) __PYX_ERR(0, 104, __pyx_L1_error)
+              __Pyx_DECREF(__pyx_t_31); __pyx_t_31 = 0;
+              __pyx_v_a = __pyx_t_43;
+
+              /* "qmeq/approach/elph/c_redfield.pyx":105
+ *                         fct_bppbp = 0
+ *                         for a in si.statesdm[charge]:
+ *                             bppa = mapdm0_[lenlst[charge]*dictdm[bpp] + dictdm[a] + shiftlst0[charge]]             # <<<<<<<<<<<<<<
+ *                             for l in range(nbaths):
+ *                                 gamma_ba_bppa = 0.5*(Vbbp[l, b, a]*Vbbp[l, bpp, a].conjugate() +
+ */
+              __pyx_t_30 = __pyx_v_charge;
+              if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+              __pyx_t_43 = __pyx_v_bpp;
+              if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+              __pyx_t_44 = __pyx_v_a;
+              if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+              __pyx_t_29 = __pyx_v_charge;
+              if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+              __pyx_t_41 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+              if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_mapdm0_.diminfo[0].shape;
+              __pyx_v_bppa = (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_mapdm0_.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_mapdm0_.diminfo[0].strides));
+
+              /* "qmeq/approach/elph/c_redfield.pyx":106
+ *                         for a in si.statesdm[charge]:
+ *                             bppa = mapdm0_[lenlst[charge]*dictdm[bpp] + dictdm[a] + shiftlst0[charge]]
+ *                             for l in range(nbaths):             # <<<<<<<<<<<<<<
+ *                                 gamma_ba_bppa = 0.5*(Vbbp[l, b, a]*Vbbp[l, bpp, a].conjugate() +
+ *                                                      Vbbp[l, a, b].conjugate()*Vbbp[l, a, bpp])
+ */
+              __pyx_t_35 = __pyx_v_nbaths;
+              __pyx_t_36 = __pyx_t_35;
+              for (__pyx_t_37 = 0; __pyx_t_37 < __pyx_t_36; __pyx_t_37+=1) {
+                __pyx_v_l = __pyx_t_37;
+
+                /* "qmeq/approach/elph/c_redfield.pyx":107
+ *                             bppa = mapdm0_[lenlst[charge]*dictdm[bpp] + dictdm[a] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ *                                 gamma_ba_bppa = 0.5*(Vbbp[l, b, a]*Vbbp[l, bpp, a].conjugate() +             # <<<<<<<<<<<<<<
+ *                                                      Vbbp[l, a, b].conjugate()*Vbbp[l, a, bpp])
+ *                                 fct_bppbp += +gamma_ba_bppa*w1fct[l, bppa, 1].conjugate()
+ */
+                __pyx_t_29 = __pyx_v_l;
+                __pyx_t_44 = __pyx_v_b;
+                __pyx_t_43 = __pyx_v_a;
+                if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+                __pyx_t_30 = __pyx_v_l;
+                __pyx_t_41 = __pyx_v_bpp;
+                __pyx_t_40 = __pyx_v_a;
+                if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+
+                /* "qmeq/approach/elph/c_redfield.pyx":108
+ *                             for l in range(nbaths):
+ *                                 gamma_ba_bppa = 0.5*(Vbbp[l, b, a]*Vbbp[l, bpp, a].conjugate() +
+ *                                                      Vbbp[l, a, b].conjugate()*Vbbp[l, a, bpp])             # <<<<<<<<<<<<<<
+ *                                 fct_bppbp += +gamma_ba_bppa*w1fct[l, bppa, 1].conjugate()
+ *                         for c in si.statesdm[charge]:
+ */
+                __pyx_t_39 = __pyx_v_l;
+                __pyx_t_38 = __pyx_v_a;
+                __pyx_t_13 = __pyx_v_b;
+                if (__pyx_t_39 < 0) __pyx_t_39 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_38 < 0) __pyx_t_38 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+                __pyx_t_42 = __pyx_v_l;
+                __pyx_t_15 = __pyx_v_a;
+                __pyx_t_14 = __pyx_v_bpp;
+                if (__pyx_t_42 < 0) __pyx_t_42 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+
+                /* "qmeq/approach/elph/c_redfield.pyx":107
+ *                             bppa = mapdm0_[lenlst[charge]*dictdm[bpp] + dictdm[a] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ *                                 gamma_ba_bppa = 0.5*(Vbbp[l, b, a]*Vbbp[l, bpp, a].conjugate() +             # <<<<<<<<<<<<<<
+ *                                                      Vbbp[l, a, b].conjugate()*Vbbp[l, a, bpp])
+ *                                 fct_bppbp += +gamma_ba_bppa*w1fct[l, bppa, 1].conjugate()
+ */
+                __pyx_v_gamma_ba_bppa = __Pyx_c_prod_double(__pyx_t_double_complex_from_parts(0.5, 0), __Pyx_c_sum_double(__Pyx_c_prod_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_44, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_43, __pyx_pybuffernd_Vbbp.diminfo[2].strides)), __Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_41, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_40, __pyx_pybuffernd_Vbbp.diminfo[2].strides)))), __Pyx_c_prod_double(__Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_39, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_38, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_13, __pyx_pybuffernd_Vbbp.diminfo[2].strides))), (*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_42, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_15, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_14, __pyx_pybuffernd_Vbbp.diminfo[2].strides)))));
+
+                /* "qmeq/approach/elph/c_redfield.pyx":109
+ *                                 gamma_ba_bppa = 0.5*(Vbbp[l, b, a]*Vbbp[l, bpp, a].conjugate() +
+ *                                                      Vbbp[l, a, b].conjugate()*Vbbp[l, a, bpp])
+ *                                 fct_bppbp += +gamma_ba_bppa*w1fct[l, bppa, 1].conjugate()             # <<<<<<<<<<<<<<
+ *                         for c in si.statesdm[charge]:
+ *                             cbpp = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[bpp] + shiftlst0[charge]]
+ */
+                __pyx_t_42 = __pyx_v_l;
+                __pyx_t_14 = __pyx_v_bppa;
+                __pyx_t_39 = 1;
+                if (__pyx_t_42 < 0) __pyx_t_42 += __pyx_pybuffernd_w1fct.diminfo[0].shape;
+                if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_w1fct.diminfo[1].shape;
+                if (__pyx_t_39 < 0) __pyx_t_39 += __pyx_pybuffernd_w1fct.diminfo[2].shape;
+                __pyx_v_fct_bppbp = __Pyx_c_sum_double(__pyx_v_fct_bppbp, __Pyx_c_prod_double(__pyx_v_gamma_ba_bppa, __Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_w1fct.rcbuffer->pybuffer.buf, __pyx_t_42, __pyx_pybuffernd_w1fct.diminfo[0].strides, __pyx_t_14, __pyx_pybuffernd_w1fct.diminfo[1].strides, __pyx_t_39, __pyx_pybuffernd_w1fct.diminfo[2].strides)))));
+              }
+
+              /* "qmeq/approach/elph/c_redfield.pyx":104
+ *                     if bppbp != -1:
+ *                         fct_bppbp = 0
+ *                         for a in si.statesdm[charge]:             # <<<<<<<<<<<<<<
+ *                             bppa = mapdm0_[lenlst[charge]*dictdm[bpp] + dictdm[a] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ */
+            }
+            __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+
+            /* "qmeq/approach/elph/c_redfield.pyx":110
+ *                                                      Vbbp[l, a, b].conjugate()*Vbbp[l, a, bpp])
+ *                                 fct_bppbp += +gamma_ba_bppa*w1fct[l, bppa, 1].conjugate()
+ *                         for c in si.statesdm[charge]:             # <<<<<<<<<<<<<<
+ *                             cbpp = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[bpp] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ */
+            __pyx_t_20 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_statesdm); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 110, __pyx_L1_error)
+            __Pyx_GOTREF(__pyx_t_20);
+            __pyx_t_31 = __Pyx_GetItemInt(__pyx_t_20, __pyx_v_charge, __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t, 1, __Pyx_PyInt_From_npy_long, 0, 1, 0); if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 110, __pyx_L1_error)
+            __Pyx_GOTREF(__pyx_t_31);
+            __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+            if (likely(PyList_CheckExact(__pyx_t_31)) || PyTuple_CheckExact(__pyx_t_31)) {
+              __pyx_t_20 = __pyx_t_31; __Pyx_INCREF(__pyx_t_20); __pyx_t_45 = 0;
+              __pyx_t_46 = NULL;
+            } else {
+              __pyx_t_45 = -1; __pyx_t_20 = PyObject_GetIter(__pyx_t_31); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 110, __pyx_L1_error)
+              __Pyx_GOTREF(__pyx_t_20);
+              __pyx_t_46 = Py_TYPE(__pyx_t_20)->tp_iternext; if (unlikely(!__pyx_t_46)) __PYX_ERR(0, 110, __pyx_L1_error)
+            }
+            __Pyx_DECREF(__pyx_t_31); __pyx_t_31 = 0;
+            for (;;) {
+              if (likely(!__pyx_t_46)) {
+                if (likely(PyList_CheckExact(__pyx_t_20))) {
+                  if (__pyx_t_45 >= PyList_GET_SIZE(__pyx_t_20)) break;
+                  #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+                  __pyx_t_31 = PyList_GET_ITEM(__pyx_t_20, __pyx_t_45); __Pyx_INCREF(__pyx_t_31); __pyx_t_45++; if (unlikely(0 < 0)) __PYX_ERR(0, 110, __pyx_L1_error)
+                  #else
+                  __pyx_t_31 = PySequence_ITEM(__pyx_t_20, __pyx_t_45); __pyx_t_45++; if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 110, __pyx_L1_error)
+                  __Pyx_GOTREF(__pyx_t_31);
+                  #endif
+                } else {
+                  if (__pyx_t_45 >= PyTuple_GET_SIZE(__pyx_t_20)) break;
+                  #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+                  __pyx_t_31 = PyTuple_GET_ITEM(__pyx_t_20, __pyx_t_45); __Pyx_INCREF(__pyx_t_31); __pyx_t_45++; if (unlikely(0 < 0)) __PYX_ERR(0, 110, __pyx_L1_error)
+                  #else
+                  __pyx_t_31 = PySequence_ITEM(__pyx_t_20, __pyx_t_45); __pyx_t_45++; if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 110, __pyx_L1_error)
+                  __Pyx_GOTREF(__pyx_t_31);
+                  #endif
+                }
+              } else {
+                __pyx_t_31 = __pyx_t_46(__pyx_t_20);
+                if (unlikely(!__pyx_t_31)) {
+                  PyObject* exc_type = PyErr_Occurred();
+                  if (exc_type) {
+                    if (likely(__Pyx_PyErr_GivenExceptionMatches(exc_type, PyExc_StopIteration))) PyErr_Clear();
+                    else __PYX_ERR(0, 110, __pyx_L1_error)
+                  }
+                  break;
+                }
+                __Pyx_GOTREF(__pyx_t_31);
+              }
+              __pyx_t_14 = __Pyx_PyInt_As_npy_int64(__pyx_t_31); if (unlikely((__pyx_t_14 == ((npy_int64)-1)) && PyErr_Occurred())) __PYX_ERR(0, 110, __pyx_L1_error)
+              __Pyx_DECREF(__pyx_t_31); __pyx_t_31 = 0;
+              __pyx_v_c = __pyx_t_14;
+
+              /* "qmeq/approach/elph/c_redfield.pyx":111
+ *                                 fct_bppbp += +gamma_ba_bppa*w1fct[l, bppa, 1].conjugate()
+ *                         for c in si.statesdm[charge]:
+ *                             cbpp = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[bpp] + shiftlst0[charge]]             # <<<<<<<<<<<<<<
+ *                             for l in range(nbaths):
+ *                                 gamma_bc_bppc = 0.5*(Vbbp[l, b, c]*Vbbp[l, bpp, c].conjugate() +
+ */
+              __pyx_t_39 = __pyx_v_charge;
+              if (__pyx_t_39 < 0) __pyx_t_39 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+              __pyx_t_14 = __pyx_v_c;
+              if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+              __pyx_t_15 = __pyx_v_bpp;
+              if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+              __pyx_t_42 = __pyx_v_charge;
+              if (__pyx_t_42 < 0) __pyx_t_42 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+              __pyx_t_13 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_39, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_14, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_15, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_42, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+              if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_mapdm0_.diminfo[0].shape;
+              __pyx_v_cbpp = (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_mapdm0_.rcbuffer->pybuffer.buf, __pyx_t_13, __pyx_pybuffernd_mapdm0_.diminfo[0].strides));
+
+              /* "qmeq/approach/elph/c_redfield.pyx":112
+ *                         for c in si.statesdm[charge]:
+ *                             cbpp = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[bpp] + shiftlst0[charge]]
+ *                             for l in range(nbaths):             # <<<<<<<<<<<<<<
+ *                                 gamma_bc_bppc = 0.5*(Vbbp[l, b, c]*Vbbp[l, bpp, c].conjugate() +
+ *                                                      Vbbp[l, c, b].conjugate()*Vbbp[l, c, bpp])
+ */
+              __pyx_t_35 = __pyx_v_nbaths;
+              __pyx_t_36 = __pyx_t_35;
+              for (__pyx_t_37 = 0; __pyx_t_37 < __pyx_t_36; __pyx_t_37+=1) {
+                __pyx_v_l = __pyx_t_37;
+
+                /* "qmeq/approach/elph/c_redfield.pyx":113
+ *                             cbpp = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[bpp] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ *                                 gamma_bc_bppc = 0.5*(Vbbp[l, b, c]*Vbbp[l, bpp, c].conjugate() +             # <<<<<<<<<<<<<<
+ *                                                      Vbbp[l, c, b].conjugate()*Vbbp[l, c, bpp])
+ *                                 fct_bppbp += +gamma_bc_bppc*w1fct[l, cbpp, 0]
+ */
+                __pyx_t_42 = __pyx_v_l;
+                __pyx_t_15 = __pyx_v_b;
+                __pyx_t_14 = __pyx_v_c;
+                if (__pyx_t_42 < 0) __pyx_t_42 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+                __pyx_t_39 = __pyx_v_l;
+                __pyx_t_13 = __pyx_v_bpp;
+                __pyx_t_38 = __pyx_v_c;
+                if (__pyx_t_39 < 0) __pyx_t_39 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_38 < 0) __pyx_t_38 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+
+                /* "qmeq/approach/elph/c_redfield.pyx":114
+ *                             for l in range(nbaths):
+ *                                 gamma_bc_bppc = 0.5*(Vbbp[l, b, c]*Vbbp[l, bpp, c].conjugate() +
+ *                                                      Vbbp[l, c, b].conjugate()*Vbbp[l, c, bpp])             # <<<<<<<<<<<<<<
+ *                                 fct_bppbp += +gamma_bc_bppc*w1fct[l, cbpp, 0]
+ *                         bppbpi = ndm0 + bppbp - npauli
+ */
+                __pyx_t_30 = __pyx_v_l;
+                __pyx_t_40 = __pyx_v_c;
+                __pyx_t_41 = __pyx_v_b;
+                if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+                __pyx_t_29 = __pyx_v_l;
+                __pyx_t_43 = __pyx_v_c;
+                __pyx_t_44 = __pyx_v_bpp;
+                if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+
+                /* "qmeq/approach/elph/c_redfield.pyx":113
+ *                             cbpp = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[bpp] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ *                                 gamma_bc_bppc = 0.5*(Vbbp[l, b, c]*Vbbp[l, bpp, c].conjugate() +             # <<<<<<<<<<<<<<
+ *                                                      Vbbp[l, c, b].conjugate()*Vbbp[l, c, bpp])
+ *                                 fct_bppbp += +gamma_bc_bppc*w1fct[l, cbpp, 0]
+ */
+                __pyx_v_gamma_bc_bppc = __Pyx_c_prod_double(__pyx_t_double_complex_from_parts(0.5, 0), __Pyx_c_sum_double(__Pyx_c_prod_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_42, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_15, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_14, __pyx_pybuffernd_Vbbp.diminfo[2].strides)), __Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_39, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_13, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_38, __pyx_pybuffernd_Vbbp.diminfo[2].strides)))), __Pyx_c_prod_double(__Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_40, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_41, __pyx_pybuffernd_Vbbp.diminfo[2].strides))), (*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_43, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_44, __pyx_pybuffernd_Vbbp.diminfo[2].strides)))));
+
+                /* "qmeq/approach/elph/c_redfield.pyx":115
+ *                                 gamma_bc_bppc = 0.5*(Vbbp[l, b, c]*Vbbp[l, bpp, c].conjugate() +
+ *                                                      Vbbp[l, c, b].conjugate()*Vbbp[l, c, bpp])
+ *                                 fct_bppbp += +gamma_bc_bppc*w1fct[l, cbpp, 0]             # <<<<<<<<<<<<<<
+ *                         bppbpi = ndm0 + bppbp - npauli
+ *                         bppbp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[bpp] + dictdm[bp] + shiftlst0[charge]] else -1
+ */
+                __pyx_t_29 = __pyx_v_l;
+                __pyx_t_44 = __pyx_v_cbpp;
+                __pyx_t_30 = 0;
+                if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_w1fct.diminfo[0].shape;
+                if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_w1fct.diminfo[1].shape;
+                if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_w1fct.diminfo[2].shape;
+                __pyx_v_fct_bppbp = __Pyx_c_sum_double(__pyx_v_fct_bppbp, __Pyx_c_prod_double(__pyx_v_gamma_bc_bppc, (*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_w1fct.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_w1fct.diminfo[0].strides, __pyx_t_44, __pyx_pybuffernd_w1fct.diminfo[1].strides, __pyx_t_30, __pyx_pybuffernd_w1fct.diminfo[2].strides))));
+              }
+
+              /* "qmeq/approach/elph/c_redfield.pyx":110
+ *                                                      Vbbp[l, a, b].conjugate()*Vbbp[l, a, bpp])
+ *                                 fct_bppbp += +gamma_ba_bppa*w1fct[l, bppa, 1].conjugate()
+ *                         for c in si.statesdm[charge]:             # <<<<<<<<<<<<<<
+ *                             cbpp = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[bpp] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ */
+            }
+            __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+
+            /* "qmeq/approach/elph/c_redfield.pyx":116
+ *                                                      Vbbp[l, c, b].conjugate()*Vbbp[l, c, bpp])
+ *                                 fct_bppbp += +gamma_bc_bppc*w1fct[l, cbpp, 0]
+ *                         bppbpi = ndm0 + bppbp - npauli             # <<<<<<<<<<<<<<
+ *                         bppbp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[bpp] + dictdm[bp] + shiftlst0[charge]] else -1
+ *                         kern[bbp, bppbp] = kern[bbp, bppbp] + fct_bppbp.imag
+ */
+            __pyx_v_bppbpi = ((__pyx_v_ndm0 + __pyx_v_bppbp) - __pyx_v_npauli);
+
+            /* "qmeq/approach/elph/c_redfield.pyx":117
+ *                                 fct_bppbp += +gamma_bc_bppc*w1fct[l, cbpp, 0]
+ *                         bppbpi = ndm0 + bppbp - npauli
+ *                         bppbp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[bpp] + dictdm[bp] + shiftlst0[charge]] else -1             # <<<<<<<<<<<<<<
+ *                         kern[bbp, bppbp] = kern[bbp, bppbp] + fct_bppbp.imag
+ *                         if bppbpi >= ndm0:
+ */
+            __pyx_t_30 = __pyx_v_charge;
+            if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+            __pyx_t_44 = __pyx_v_bpp;
+            if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_43 = __pyx_v_bp;
+            if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_29 = __pyx_v_charge;
+            if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+            __pyx_t_41 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+            if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_conjdm0.diminfo[0].shape;
+            if (((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_bool_t *, __pyx_pybuffernd_conjdm0.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_conjdm0.diminfo[0].strides)) != 0)) {
+              __pyx_t_35 = 1;
+            } else {
+              __pyx_t_35 = -1L;
+            }
+            __pyx_v_bppbp_sgn = __pyx_t_35;
+
+            /* "qmeq/approach/elph/c_redfield.pyx":118
+ *                         bppbpi = ndm0 + bppbp - npauli
+ *                         bppbp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[bpp] + dictdm[bp] + shiftlst0[charge]] else -1
+ *                         kern[bbp, bppbp] = kern[bbp, bppbp] + fct_bppbp.imag             # <<<<<<<<<<<<<<
+ *                         if bppbpi >= ndm0:
+ *                             kern[bbp, bppbpi] = kern[bbp, bppbpi] + fct_bppbp.real*bppbp_sgn
+ */
+            __pyx_t_43 = __pyx_v_bbp;
+            __pyx_t_44 = __pyx_v_bppbp;
+            if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_kern.diminfo[0].shape;
+            if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_kern.diminfo[1].shape;
+            __pyx_t_41 = __pyx_v_bbp;
+            __pyx_t_40 = __pyx_v_bppbp;
+            if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_kern.diminfo[0].shape;
+            if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_kern.diminfo[1].shape;
+            *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_40, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_44, __pyx_pybuffernd_kern.diminfo[1].strides)) + __Pyx_CIMAG(__pyx_v_fct_bppbp));
+
+            /* "qmeq/approach/elph/c_redfield.pyx":119
+ *                         bppbp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[bpp] + dictdm[bp] + shiftlst0[charge]] else -1
+ *                         kern[bbp, bppbp] = kern[bbp, bppbp] + fct_bppbp.imag
+ *                         if bppbpi >= ndm0:             # <<<<<<<<<<<<<<
+ *                             kern[bbp, bppbpi] = kern[bbp, bppbpi] + fct_bppbp.real*bppbp_sgn
+ *                             if bbpi_bool:
+ */
+            __pyx_t_18 = ((__pyx_v_bppbpi >= __pyx_v_ndm0) != 0);
+            if (__pyx_t_18) {
+
+              /* "qmeq/approach/elph/c_redfield.pyx":120
+ *                         kern[bbp, bppbp] = kern[bbp, bppbp] + fct_bppbp.imag
+ *                         if bppbpi >= ndm0:
+ *                             kern[bbp, bppbpi] = kern[bbp, bppbpi] + fct_bppbp.real*bppbp_sgn             # <<<<<<<<<<<<<<
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, bppbpi] = kern[bbpi, bppbpi] + fct_bppbp.imag*bppbp_sgn
+ */
+              __pyx_t_44 = __pyx_v_bbp;
+              __pyx_t_43 = __pyx_v_bppbpi;
+              if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              __pyx_t_40 = __pyx_v_bbp;
+              __pyx_t_41 = __pyx_v_bppbpi;
+              if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_40, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_41, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_43, __pyx_pybuffernd_kern.diminfo[1].strides)) + (__Pyx_CREAL(__pyx_v_fct_bppbp) * __pyx_v_bppbp_sgn));
+
+              /* "qmeq/approach/elph/c_redfield.pyx":121
+ *                         if bppbpi >= ndm0:
+ *                             kern[bbp, bppbpi] = kern[bbp, bppbpi] + fct_bppbp.real*bppbp_sgn
+ *                             if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                                 kern[bbpi, bppbpi] = kern[bbpi, bppbpi] + fct_bppbp.imag*bppbp_sgn
+ *                         if bbpi_bool:
+ */
+              __pyx_t_18 = (__pyx_v_bbpi_bool != 0);
+              if (__pyx_t_18) {
+
+                /* "qmeq/approach/elph/c_redfield.pyx":122
+ *                             kern[bbp, bppbpi] = kern[bbp, bppbpi] + fct_bppbp.real*bppbp_sgn
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, bppbpi] = kern[bbpi, bppbpi] + fct_bppbp.imag*bppbp_sgn             # <<<<<<<<<<<<<<
+ *                         if bbpi_bool:
+ *                             kern[bbpi, bppbp] = kern[bbpi, bppbp] - fct_bppbp.real
+ */
+                __pyx_t_43 = __pyx_v_bbpi;
+                __pyx_t_44 = __pyx_v_bppbpi;
+                if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_kern.diminfo[0].shape;
+                if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_kern.diminfo[1].shape;
+                __pyx_t_41 = __pyx_v_bbpi;
+                __pyx_t_40 = __pyx_v_bppbpi;
+                if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_kern.diminfo[0].shape;
+                if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_kern.diminfo[1].shape;
+                *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_40, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_44, __pyx_pybuffernd_kern.diminfo[1].strides)) + (__Pyx_CIMAG(__pyx_v_fct_bppbp) * __pyx_v_bppbp_sgn));
+
+                /* "qmeq/approach/elph/c_redfield.pyx":121
+ *                         if bppbpi >= ndm0:
+ *                             kern[bbp, bppbpi] = kern[bbp, bppbpi] + fct_bppbp.real*bppbp_sgn
+ *                             if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                                 kern[bbpi, bppbpi] = kern[bbpi, bppbpi] + fct_bppbp.imag*bppbp_sgn
+ *                         if bbpi_bool:
+ */
+              }
+
+              /* "qmeq/approach/elph/c_redfield.pyx":119
+ *                         bppbp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[bpp] + dictdm[bp] + shiftlst0[charge]] else -1
+ *                         kern[bbp, bppbp] = kern[bbp, bppbp] + fct_bppbp.imag
+ *                         if bppbpi >= ndm0:             # <<<<<<<<<<<<<<
+ *                             kern[bbp, bppbpi] = kern[bbp, bppbpi] + fct_bppbp.real*bppbp_sgn
+ *                             if bbpi_bool:
+ */
+            }
+
+            /* "qmeq/approach/elph/c_redfield.pyx":123
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, bppbpi] = kern[bbpi, bppbpi] + fct_bppbp.imag*bppbp_sgn
+ *                         if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                             kern[bbpi, bppbp] = kern[bbpi, bppbp] - fct_bppbp.real
+ *                     # --------------------------------------------------
+ */
+            __pyx_t_18 = (__pyx_v_bbpi_bool != 0);
+            if (__pyx_t_18) {
+
+              /* "qmeq/approach/elph/c_redfield.pyx":124
+ *                                 kern[bbpi, bppbpi] = kern[bbpi, bppbpi] + fct_bppbp.imag*bppbp_sgn
+ *                         if bbpi_bool:
+ *                             kern[bbpi, bppbp] = kern[bbpi, bppbp] - fct_bppbp.real             # <<<<<<<<<<<<<<
+ *                     # --------------------------------------------------
+ *                     bbpp = mapdm0[lenlst[charge]*dictdm[b] + dictdm[bpp] + shiftlst0[charge]]
+ */
+              __pyx_t_44 = __pyx_v_bbpi;
+              __pyx_t_43 = __pyx_v_bppbp;
+              if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              __pyx_t_40 = __pyx_v_bbpi;
+              __pyx_t_41 = __pyx_v_bppbp;
+              if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_40, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_41, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_43, __pyx_pybuffernd_kern.diminfo[1].strides)) - __Pyx_CREAL(__pyx_v_fct_bppbp));
+
+              /* "qmeq/approach/elph/c_redfield.pyx":123
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, bppbpi] = kern[bbpi, bppbpi] + fct_bppbp.imag*bppbp_sgn
+ *                         if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                             kern[bbpi, bppbp] = kern[bbpi, bppbp] - fct_bppbp.real
+ *                     # --------------------------------------------------
+ */
+            }
+
+            /* "qmeq/approach/elph/c_redfield.pyx":102
+ *                 for bpp in si.statesdm[charge]:
+ *                     bppbp = mapdm0[lenlst[charge]*dictdm[bpp] + dictdm[bp] + shiftlst0[charge]]
+ *                     if bppbp != -1:             # <<<<<<<<<<<<<<
+ *                         fct_bppbp = 0
+ *                         for a in si.statesdm[charge]:
+ */
+          }
+
+          /* "qmeq/approach/elph/c_redfield.pyx":126
+ *                             kern[bbpi, bppbp] = kern[bbpi, bppbp] - fct_bppbp.real
+ *                     # --------------------------------------------------
+ *                     bbpp = mapdm0[lenlst[charge]*dictdm[b] + dictdm[bpp] + shiftlst0[charge]]             # <<<<<<<<<<<<<<
+ *                     if bbpp != -1:
+ *                         fct_bbpp = 0
+ */
+          __pyx_t_29 = __pyx_v_charge;
+          if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+          __pyx_t_43 = __pyx_v_b;
+          if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+          __pyx_t_44 = __pyx_v_bpp;
+          if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+          __pyx_t_30 = __pyx_v_charge;
+          if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+          __pyx_t_41 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+          if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_mapdm0.diminfo[0].shape;
+          __pyx_v_bbpp = (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_mapdm0.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_mapdm0.diminfo[0].strides));
+
+          /* "qmeq/approach/elph/c_redfield.pyx":127
+ *                     # --------------------------------------------------
+ *                     bbpp = mapdm0[lenlst[charge]*dictdm[b] + dictdm[bpp] + shiftlst0[charge]]
+ *                     if bbpp != -1:             # <<<<<<<<<<<<<<
+ *                         fct_bbpp = 0
+ *                         for a in si.statesdm[charge]:
+ */
+          __pyx_t_18 = ((__pyx_v_bbpp != -1LL) != 0);
+          if (__pyx_t_18) {
+
+            /* "qmeq/approach/elph/c_redfield.pyx":128
+ *                     bbpp = mapdm0[lenlst[charge]*dictdm[b] + dictdm[bpp] + shiftlst0[charge]]
+ *                     if bbpp != -1:
+ *                         fct_bbpp = 0             # <<<<<<<<<<<<<<
+ *                         for a in si.statesdm[charge]:
+ *                             bppa = mapdm0_[lenlst[charge]*dictdm[bpp] + dictdm[a] + shiftlst0[charge]]
+ */
+            __pyx_v_fct_bbpp = __pyx_t_double_complex_from_parts(0, 0);
+
+            /* "qmeq/approach/elph/c_redfield.pyx":129
+ *                     if bbpp != -1:
+ *                         fct_bbpp = 0
+ *                         for a in si.statesdm[charge]:             # <<<<<<<<<<<<<<
+ *                             bppa = mapdm0_[lenlst[charge]*dictdm[bpp] + dictdm[a] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ */
+            __pyx_t_20 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_statesdm); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 129, __pyx_L1_error)
+            __Pyx_GOTREF(__pyx_t_20);
+            __pyx_t_31 = __Pyx_GetItemInt(__pyx_t_20, __pyx_v_charge, __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t, 1, __Pyx_PyInt_From_npy_long, 0, 1, 0); if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 129, __pyx_L1_error)
+            __Pyx_GOTREF(__pyx_t_31);
+            __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+            if (likely(PyList_CheckExact(__pyx_t_31)) || PyTuple_CheckExact(__pyx_t_31)) {
+              __pyx_t_20 = __pyx_t_31; __Pyx_INCREF(__pyx_t_20); __pyx_t_45 = 0;
+              __pyx_t_46 = NULL;
+            } else {
+              __pyx_t_45 = -1; __pyx_t_20 = PyObject_GetIter(__pyx_t_31); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 129, __pyx_L1_error)
+              __Pyx_GOTREF(__pyx_t_20);
+              __pyx_t_46 = Py_TYPE(__pyx_t_20)->tp_iternext; if (unlikely(!__pyx_t_46)) __PYX_ERR(0, 129, __pyx_L1_error)
+            }
+            __Pyx_DECREF(__pyx_t_31); __pyx_t_31 = 0;
+            for (;;) {
+              if (likely(!__pyx_t_46)) {
+                if (likely(PyList_CheckExact(__pyx_t_20))) {
+                  if (__pyx_t_45 >= PyList_GET_SIZE(__pyx_t_20)) break;
+                  #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+                  __pyx_t_31 = PyList_GET_ITEM(__pyx_t_20, __pyx_t_45); __Pyx_INCREF(__pyx_t_31); __pyx_t_45++; if (unlikely(0 < 0)) __PYX_ERR(0, 129, __pyx_L1_error)
+                  #else
+                  __pyx_t_31 = PySequence_ITEM(__pyx_t_20, __pyx_t_45); __pyx_t_45++; if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 129, __pyx_L1_error)
+                  __Pyx_GOTREF(__pyx_t_31);
+                  #endif
+                } else {
+                  if (__pyx_t_45 >= PyTuple_GET_SIZE(__pyx_t_20)) break;
+                  #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+                  __pyx_t_31 = PyTuple_GET_ITEM(__pyx_t_20, __pyx_t_45); __Pyx_INCREF(__pyx_t_31); __pyx_t_45++; if (unlikely(0 < 0)) __PYX_ERR(0, 129, __pyx_L1_error)
+                  #else
+                  __pyx_t_31 = PySequence_ITEM(__pyx_t_20, __pyx_t_45); __pyx_t_45++; if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 129, __pyx_L1_error)
+                  __Pyx_GOTREF(__pyx_t_31);
+                  #endif
+                }
+              } else {
+                __pyx_t_31 = __pyx_t_46(__pyx_t_20);
+                if (unlikely(!__pyx_t_31)) {
+                  PyObject* exc_type = PyErr_Occurred();
+                  if (exc_type) {
+                    if (likely(__Pyx_PyErr_GivenExceptionMatches(exc_type, PyExc_StopIteration))) PyErr_Clear();
+                    else __PYX_ERR(0, 129, __pyx_L1_error)
+                  }
+                  break;
+                }
+                __Pyx_GOTREF(__pyx_t_31);
+              }
+              __pyx_t_44 = __Pyx_PyInt_As_npy_int64(__pyx_t_31); if (unlikely((__pyx_t_44 == ((npy_int64)-1)) && PyErr_Occurred())) __PYX_ERR(0, 129, __pyx_L1_error)
+              __Pyx_DECREF(__pyx_t_31); __pyx_t_31 = 0;
+              __pyx_v_a = __pyx_t_44;
+
+              /* "qmeq/approach/elph/c_redfield.pyx":130
+ *                         fct_bbpp = 0
+ *                         for a in si.statesdm[charge]:
+ *                             bppa = mapdm0_[lenlst[charge]*dictdm[bpp] + dictdm[a] + shiftlst0[charge]]             # <<<<<<<<<<<<<<
+ *                             for l in range(nbaths):
+ *                                 gamma_abpp_abp = 0.5*(Vbbp[l, a, bpp].conjugate()*Vbbp[l, a, bp] +
+ */
+              __pyx_t_30 = __pyx_v_charge;
+              if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+              __pyx_t_44 = __pyx_v_bpp;
+              if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+              __pyx_t_43 = __pyx_v_a;
+              if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+              __pyx_t_29 = __pyx_v_charge;
+              if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+              __pyx_t_41 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+              if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_mapdm0_.diminfo[0].shape;
+              __pyx_v_bppa = (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_mapdm0_.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_mapdm0_.diminfo[0].strides));
+
+              /* "qmeq/approach/elph/c_redfield.pyx":131
+ *                         for a in si.statesdm[charge]:
+ *                             bppa = mapdm0_[lenlst[charge]*dictdm[bpp] + dictdm[a] + shiftlst0[charge]]
+ *                             for l in range(nbaths):             # <<<<<<<<<<<<<<
+ *                                 gamma_abpp_abp = 0.5*(Vbbp[l, a, bpp].conjugate()*Vbbp[l, a, bp] +
+ *                                                       Vbbp[l, bpp, a]*Vbbp[l, bp, a].conjugate())
+ */
+              __pyx_t_35 = __pyx_v_nbaths;
+              __pyx_t_36 = __pyx_t_35;
+              for (__pyx_t_37 = 0; __pyx_t_37 < __pyx_t_36; __pyx_t_37+=1) {
+                __pyx_v_l = __pyx_t_37;
+
+                /* "qmeq/approach/elph/c_redfield.pyx":132
+ *                             bppa = mapdm0_[lenlst[charge]*dictdm[bpp] + dictdm[a] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ *                                 gamma_abpp_abp = 0.5*(Vbbp[l, a, bpp].conjugate()*Vbbp[l, a, bp] +             # <<<<<<<<<<<<<<
+ *                                                       Vbbp[l, bpp, a]*Vbbp[l, bp, a].conjugate())
+ *                                 fct_bbpp += -gamma_abpp_abp*w1fct[l, bppa, 1]
+ */
+                __pyx_t_29 = __pyx_v_l;
+                __pyx_t_43 = __pyx_v_a;
+                __pyx_t_44 = __pyx_v_bpp;
+                if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+                __pyx_t_30 = __pyx_v_l;
+                __pyx_t_41 = __pyx_v_a;
+                __pyx_t_40 = __pyx_v_bp;
+                if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+
+                /* "qmeq/approach/elph/c_redfield.pyx":133
+ *                             for l in range(nbaths):
+ *                                 gamma_abpp_abp = 0.5*(Vbbp[l, a, bpp].conjugate()*Vbbp[l, a, bp] +
+ *                                                       Vbbp[l, bpp, a]*Vbbp[l, bp, a].conjugate())             # <<<<<<<<<<<<<<
+ *                                 fct_bbpp += -gamma_abpp_abp*w1fct[l, bppa, 1]
+ *                         for c in si.statesdm[charge]:
+ */
+                __pyx_t_39 = __pyx_v_l;
+                __pyx_t_38 = __pyx_v_bpp;
+                __pyx_t_13 = __pyx_v_a;
+                if (__pyx_t_39 < 0) __pyx_t_39 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_38 < 0) __pyx_t_38 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+                __pyx_t_42 = __pyx_v_l;
+                __pyx_t_14 = __pyx_v_bp;
+                __pyx_t_15 = __pyx_v_a;
+                if (__pyx_t_42 < 0) __pyx_t_42 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+
+                /* "qmeq/approach/elph/c_redfield.pyx":132
+ *                             bppa = mapdm0_[lenlst[charge]*dictdm[bpp] + dictdm[a] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ *                                 gamma_abpp_abp = 0.5*(Vbbp[l, a, bpp].conjugate()*Vbbp[l, a, bp] +             # <<<<<<<<<<<<<<
+ *                                                       Vbbp[l, bpp, a]*Vbbp[l, bp, a].conjugate())
+ *                                 fct_bbpp += -gamma_abpp_abp*w1fct[l, bppa, 1]
+ */
+                __pyx_v_gamma_abpp_abp = __Pyx_c_prod_double(__pyx_t_double_complex_from_parts(0.5, 0), __Pyx_c_sum_double(__Pyx_c_prod_double(__Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_43, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_44, __pyx_pybuffernd_Vbbp.diminfo[2].strides))), (*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_41, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_40, __pyx_pybuffernd_Vbbp.diminfo[2].strides))), __Pyx_c_prod_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_39, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_38, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_13, __pyx_pybuffernd_Vbbp.diminfo[2].strides)), __Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_42, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_14, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_15, __pyx_pybuffernd_Vbbp.diminfo[2].strides))))));
+
+                /* "qmeq/approach/elph/c_redfield.pyx":134
+ *                                 gamma_abpp_abp = 0.5*(Vbbp[l, a, bpp].conjugate()*Vbbp[l, a, bp] +
+ *                                                       Vbbp[l, bpp, a]*Vbbp[l, bp, a].conjugate())
+ *                                 fct_bbpp += -gamma_abpp_abp*w1fct[l, bppa, 1]             # <<<<<<<<<<<<<<
+ *                         for c in si.statesdm[charge]:
+ *                             cbpp = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[bpp] + shiftlst0[charge]]
+ */
+                __pyx_t_42 = __pyx_v_l;
+                __pyx_t_15 = __pyx_v_bppa;
+                __pyx_t_39 = 1;
+                if (__pyx_t_42 < 0) __pyx_t_42 += __pyx_pybuffernd_w1fct.diminfo[0].shape;
+                if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_w1fct.diminfo[1].shape;
+                if (__pyx_t_39 < 0) __pyx_t_39 += __pyx_pybuffernd_w1fct.diminfo[2].shape;
+                __pyx_v_fct_bbpp = __Pyx_c_sum_double(__pyx_v_fct_bbpp, __Pyx_c_prod_double(__Pyx_c_neg_double(__pyx_v_gamma_abpp_abp), (*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_w1fct.rcbuffer->pybuffer.buf, __pyx_t_42, __pyx_pybuffernd_w1fct.diminfo[0].strides, __pyx_t_15, __pyx_pybuffernd_w1fct.diminfo[1].strides, __pyx_t_39, __pyx_pybuffernd_w1fct.diminfo[2].strides))));
+              }
+
+              /* "qmeq/approach/elph/c_redfield.pyx":129
+ *                     if bbpp != -1:
+ *                         fct_bbpp = 0
+ *                         for a in si.statesdm[charge]:             # <<<<<<<<<<<<<<
+ *                             bppa = mapdm0_[lenlst[charge]*dictdm[bpp] + dictdm[a] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ */
+            }
+            __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+
+            /* "qmeq/approach/elph/c_redfield.pyx":135
+ *                                                       Vbbp[l, bpp, a]*Vbbp[l, bp, a].conjugate())
+ *                                 fct_bbpp += -gamma_abpp_abp*w1fct[l, bppa, 1]
+ *                         for c in si.statesdm[charge]:             # <<<<<<<<<<<<<<
+ *                             cbpp = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[bpp] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ */
+            __pyx_t_20 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_statesdm); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 135, __pyx_L1_error)
+            __Pyx_GOTREF(__pyx_t_20);
+            __pyx_t_31 = __Pyx_GetItemInt(__pyx_t_20, __pyx_v_charge, __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t, 1, __Pyx_PyInt_From_npy_long, 0, 1, 0); if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 135, __pyx_L1_error)
+            __Pyx_GOTREF(__pyx_t_31);
+            __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+            if (likely(PyList_CheckExact(__pyx_t_31)) || PyTuple_CheckExact(__pyx_t_31)) {
+              __pyx_t_20 = __pyx_t_31; __Pyx_INCREF(__pyx_t_20); __pyx_t_45 = 0;
+              __pyx_t_46 = NULL;
+            } else {
+              __pyx_t_45 = -1; __pyx_t_20 = PyObject_GetIter(__pyx_t_31); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 135, __pyx_L1_error)
+              __Pyx_GOTREF(__pyx_t_20);
+              __pyx_t_46 = Py_TYPE(__pyx_t_20)->tp_iternext; if (unlikely(!__pyx_t_46)) __PYX_ERR(0, 135, __pyx_L1_error)
+            }
+            __Pyx_DECREF(__pyx_t_31); __pyx_t_31 = 0;
+            for (;;) {
+              if (likely(!__pyx_t_46)) {
+                if (likely(PyList_CheckExact(__pyx_t_20))) {
+                  if (__pyx_t_45 >= PyList_GET_SIZE(__pyx_t_20)) break;
+                  #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+                  __pyx_t_31 = PyList_GET_ITEM(__pyx_t_20, __pyx_t_45); __Pyx_INCREF(__pyx_t_31); __pyx_t_45++; if (unlikely(0 < 0)) __PYX_ERR(0, 135, __pyx_L1_error)
+                  #else
+                  __pyx_t_31 = PySequence_ITEM(__pyx_t_20, __pyx_t_45); __pyx_t_45++; if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 135, __pyx_L1_error)
+                  __Pyx_GOTREF(__pyx_t_31);
+                  #endif
+                } else {
+                  if (__pyx_t_45 >= PyTuple_GET_SIZE(__pyx_t_20)) break;
+                  #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+                  __pyx_t_31 = PyTuple_GET_ITEM(__pyx_t_20, __pyx_t_45); __Pyx_INCREF(__pyx_t_31); __pyx_t_45++; if (unlikely(0 < 0)) __PYX_ERR(0, 135, __pyx_L1_error)
+                  #else
+                  __pyx_t_31 = PySequence_ITEM(__pyx_t_20, __pyx_t_45); __pyx_t_45++; if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 135, __pyx_L1_error)
+                  __Pyx_GOTREF(__pyx_t_31);
+                  #endif
+                }
+              } else {
+                __pyx_t_31 = __pyx_t_46(__pyx_t_20);
+                if (unlikely(!__pyx_t_31)) {
+                  PyObject* exc_type = PyErr_Occurred();
+                  if (exc_type) {
+                    if (likely(__Pyx_PyErr_GivenExceptionMatches(exc_type, PyExc_StopIteration))) PyErr_Clear();
+                    else __PYX_ERR(0, 135, __pyx_L1_error)
+                  }
+                  break;
+                }
+                __Pyx_GOTREF(__pyx_t_31);
+              }
+              __pyx_t_15 = __Pyx_PyInt_As_npy_int64(__pyx_t_31); if (unlikely((__pyx_t_15 == ((npy_int64)-1)) && PyErr_Occurred())) __PYX_ERR(0, 135, __pyx_L1_error)
+              __Pyx_DECREF(__pyx_t_31); __pyx_t_31 = 0;
+              __pyx_v_c = __pyx_t_15;
+
+              /* "qmeq/approach/elph/c_redfield.pyx":136
+ *                                 fct_bbpp += -gamma_abpp_abp*w1fct[l, bppa, 1]
+ *                         for c in si.statesdm[charge]:
+ *                             cbpp = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[bpp] + shiftlst0[charge]]             # <<<<<<<<<<<<<<
+ *                             for l in range(nbaths):
+ *                                 gamma_cbpp_cbp = 0.5*(Vbbp[l, c, bpp].conjugate()*Vbbp[l, c, bp] +
+ */
+              __pyx_t_39 = __pyx_v_charge;
+              if (__pyx_t_39 < 0) __pyx_t_39 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+              __pyx_t_15 = __pyx_v_c;
+              if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+              __pyx_t_14 = __pyx_v_bpp;
+              if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+              __pyx_t_42 = __pyx_v_charge;
+              if (__pyx_t_42 < 0) __pyx_t_42 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+              __pyx_t_13 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_39, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_15, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_14, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_42, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+              if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_mapdm0_.diminfo[0].shape;
+              __pyx_v_cbpp = (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_mapdm0_.rcbuffer->pybuffer.buf, __pyx_t_13, __pyx_pybuffernd_mapdm0_.diminfo[0].strides));
+
+              /* "qmeq/approach/elph/c_redfield.pyx":137
+ *                         for c in si.statesdm[charge]:
+ *                             cbpp = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[bpp] + shiftlst0[charge]]
+ *                             for l in range(nbaths):             # <<<<<<<<<<<<<<
+ *                                 gamma_cbpp_cbp = 0.5*(Vbbp[l, c, bpp].conjugate()*Vbbp[l, c, bp] +
+ *                                                       Vbbp[l, bpp, c]*Vbbp[l, bp, c].conjugate())
+ */
+              __pyx_t_35 = __pyx_v_nbaths;
+              __pyx_t_36 = __pyx_t_35;
+              for (__pyx_t_37 = 0; __pyx_t_37 < __pyx_t_36; __pyx_t_37+=1) {
+                __pyx_v_l = __pyx_t_37;
+
+                /* "qmeq/approach/elph/c_redfield.pyx":138
+ *                             cbpp = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[bpp] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ *                                 gamma_cbpp_cbp = 0.5*(Vbbp[l, c, bpp].conjugate()*Vbbp[l, c, bp] +             # <<<<<<<<<<<<<<
+ *                                                       Vbbp[l, bpp, c]*Vbbp[l, bp, c].conjugate())
+ *                                 fct_bbpp += -gamma_cbpp_cbp*w1fct[l, cbpp, 0].conjugate()
+ */
+                __pyx_t_42 = __pyx_v_l;
+                __pyx_t_14 = __pyx_v_c;
+                __pyx_t_15 = __pyx_v_bpp;
+                if (__pyx_t_42 < 0) __pyx_t_42 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+                __pyx_t_39 = __pyx_v_l;
+                __pyx_t_13 = __pyx_v_c;
+                __pyx_t_38 = __pyx_v_bp;
+                if (__pyx_t_39 < 0) __pyx_t_39 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_38 < 0) __pyx_t_38 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+
+                /* "qmeq/approach/elph/c_redfield.pyx":139
+ *                             for l in range(nbaths):
+ *                                 gamma_cbpp_cbp = 0.5*(Vbbp[l, c, bpp].conjugate()*Vbbp[l, c, bp] +
+ *                                                       Vbbp[l, bpp, c]*Vbbp[l, bp, c].conjugate())             # <<<<<<<<<<<<<<
+ *                                 fct_bbpp += -gamma_cbpp_cbp*w1fct[l, cbpp, 0].conjugate()
+ *                         bbppi = ndm0 + bbpp - npauli
+ */
+                __pyx_t_30 = __pyx_v_l;
+                __pyx_t_40 = __pyx_v_bpp;
+                __pyx_t_41 = __pyx_v_c;
+                if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+                __pyx_t_29 = __pyx_v_l;
+                __pyx_t_44 = __pyx_v_bp;
+                __pyx_t_43 = __pyx_v_c;
+                if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+                if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+                if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+
+                /* "qmeq/approach/elph/c_redfield.pyx":138
+ *                             cbpp = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[bpp] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ *                                 gamma_cbpp_cbp = 0.5*(Vbbp[l, c, bpp].conjugate()*Vbbp[l, c, bp] +             # <<<<<<<<<<<<<<
+ *                                                       Vbbp[l, bpp, c]*Vbbp[l, bp, c].conjugate())
+ *                                 fct_bbpp += -gamma_cbpp_cbp*w1fct[l, cbpp, 0].conjugate()
+ */
+                __pyx_v_gamma_cbpp_cbp = __Pyx_c_prod_double(__pyx_t_double_complex_from_parts(0.5, 0), __Pyx_c_sum_double(__Pyx_c_prod_double(__Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_42, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_14, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_15, __pyx_pybuffernd_Vbbp.diminfo[2].strides))), (*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_39, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_13, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_38, __pyx_pybuffernd_Vbbp.diminfo[2].strides))), __Pyx_c_prod_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_40, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_41, __pyx_pybuffernd_Vbbp.diminfo[2].strides)), __Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_44, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_43, __pyx_pybuffernd_Vbbp.diminfo[2].strides))))));
+
+                /* "qmeq/approach/elph/c_redfield.pyx":140
+ *                                 gamma_cbpp_cbp = 0.5*(Vbbp[l, c, bpp].conjugate()*Vbbp[l, c, bp] +
+ *                                                       Vbbp[l, bpp, c]*Vbbp[l, bp, c].conjugate())
+ *                                 fct_bbpp += -gamma_cbpp_cbp*w1fct[l, cbpp, 0].conjugate()             # <<<<<<<<<<<<<<
+ *                         bbppi = ndm0 + bbpp - npauli
+ *                         bbpp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[b] + dictdm[bpp] + shiftlst0[charge]] else -1
+ */
+                __pyx_t_29 = __pyx_v_l;
+                __pyx_t_43 = __pyx_v_cbpp;
+                __pyx_t_30 = 0;
+                if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_w1fct.diminfo[0].shape;
+                if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_w1fct.diminfo[1].shape;
+                if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_w1fct.diminfo[2].shape;
+                __pyx_v_fct_bbpp = __Pyx_c_sum_double(__pyx_v_fct_bbpp, __Pyx_c_prod_double(__Pyx_c_neg_double(__pyx_v_gamma_cbpp_cbp), __Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_w1fct.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_w1fct.diminfo[0].strides, __pyx_t_43, __pyx_pybuffernd_w1fct.diminfo[1].strides, __pyx_t_30, __pyx_pybuffernd_w1fct.diminfo[2].strides)))));
+              }
+
+              /* "qmeq/approach/elph/c_redfield.pyx":135
+ *                                                       Vbbp[l, bpp, a]*Vbbp[l, bp, a].conjugate())
+ *                                 fct_bbpp += -gamma_abpp_abp*w1fct[l, bppa, 1]
+ *                         for c in si.statesdm[charge]:             # <<<<<<<<<<<<<<
+ *                             cbpp = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[bpp] + shiftlst0[charge]]
+ *                             for l in range(nbaths):
+ */
+            }
+            __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+
+            /* "qmeq/approach/elph/c_redfield.pyx":141
+ *                                                       Vbbp[l, bpp, c]*Vbbp[l, bp, c].conjugate())
+ *                                 fct_bbpp += -gamma_cbpp_cbp*w1fct[l, cbpp, 0].conjugate()
+ *                         bbppi = ndm0 + bbpp - npauli             # <<<<<<<<<<<<<<
+ *                         bbpp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[b] + dictdm[bpp] + shiftlst0[charge]] else -1
+ *                         kern[bbp, bbpp] = kern[bbp, bbpp] + fct_bbpp.imag
+ */
+            __pyx_v_bbppi = ((__pyx_v_ndm0 + __pyx_v_bbpp) - __pyx_v_npauli);
+
+            /* "qmeq/approach/elph/c_redfield.pyx":142
+ *                                 fct_bbpp += -gamma_cbpp_cbp*w1fct[l, cbpp, 0].conjugate()
+ *                         bbppi = ndm0 + bbpp - npauli
+ *                         bbpp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[b] + dictdm[bpp] + shiftlst0[charge]] else -1             # <<<<<<<<<<<<<<
+ *                         kern[bbp, bbpp] = kern[bbp, bbpp] + fct_bbpp.imag
+ *                         if bbppi >= ndm0:
+ */
+            __pyx_t_30 = __pyx_v_charge;
+            if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+            __pyx_t_43 = __pyx_v_b;
+            if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_44 = __pyx_v_bpp;
+            if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_29 = __pyx_v_charge;
+            if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+            __pyx_t_41 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+            if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_conjdm0.diminfo[0].shape;
+            if (((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_bool_t *, __pyx_pybuffernd_conjdm0.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_conjdm0.diminfo[0].strides)) != 0)) {
+              __pyx_t_35 = 1;
+            } else {
+              __pyx_t_35 = -1L;
+            }
+            __pyx_v_bbpp_sgn = __pyx_t_35;
+
+            /* "qmeq/approach/elph/c_redfield.pyx":143
+ *                         bbppi = ndm0 + bbpp - npauli
+ *                         bbpp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[b] + dictdm[bpp] + shiftlst0[charge]] else -1
+ *                         kern[bbp, bbpp] = kern[bbp, bbpp] + fct_bbpp.imag             # <<<<<<<<<<<<<<
+ *                         if bbppi >= ndm0:
+ *                             kern[bbp, bbppi] = kern[bbp, bbppi] + fct_bbpp.real*bbpp_sgn
+ */
+            __pyx_t_44 = __pyx_v_bbp;
+            __pyx_t_43 = __pyx_v_bbpp;
+            if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_kern.diminfo[0].shape;
+            if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_kern.diminfo[1].shape;
+            __pyx_t_41 = __pyx_v_bbp;
+            __pyx_t_40 = __pyx_v_bbpp;
+            if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_kern.diminfo[0].shape;
+            if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_kern.diminfo[1].shape;
+            *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_40, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_43, __pyx_pybuffernd_kern.diminfo[1].strides)) + __Pyx_CIMAG(__pyx_v_fct_bbpp));
+
+            /* "qmeq/approach/elph/c_redfield.pyx":144
+ *                         bbpp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[b] + dictdm[bpp] + shiftlst0[charge]] else -1
+ *                         kern[bbp, bbpp] = kern[bbp, bbpp] + fct_bbpp.imag
+ *                         if bbppi >= ndm0:             # <<<<<<<<<<<<<<
+ *                             kern[bbp, bbppi] = kern[bbp, bbppi] + fct_bbpp.real*bbpp_sgn
+ *                             if bbpi_bool:
+ */
+            __pyx_t_18 = ((__pyx_v_bbppi >= __pyx_v_ndm0) != 0);
+            if (__pyx_t_18) {
+
+              /* "qmeq/approach/elph/c_redfield.pyx":145
+ *                         kern[bbp, bbpp] = kern[bbp, bbpp] + fct_bbpp.imag
+ *                         if bbppi >= ndm0:
+ *                             kern[bbp, bbppi] = kern[bbp, bbppi] + fct_bbpp.real*bbpp_sgn             # <<<<<<<<<<<<<<
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, bbppi] = kern[bbpi, bbppi] + fct_bbpp.imag*bbpp_sgn
+ */
+              __pyx_t_43 = __pyx_v_bbp;
+              __pyx_t_44 = __pyx_v_bbppi;
+              if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              __pyx_t_40 = __pyx_v_bbp;
+              __pyx_t_41 = __pyx_v_bbppi;
+              if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_40, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_41, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_44, __pyx_pybuffernd_kern.diminfo[1].strides)) + (__Pyx_CREAL(__pyx_v_fct_bbpp) * __pyx_v_bbpp_sgn));
+
+              /* "qmeq/approach/elph/c_redfield.pyx":146
+ *                         if bbppi >= ndm0:
+ *                             kern[bbp, bbppi] = kern[bbp, bbppi] + fct_bbpp.real*bbpp_sgn
+ *                             if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                                 kern[bbpi, bbppi] = kern[bbpi, bbppi] + fct_bbpp.imag*bbpp_sgn
+ *                         if bbpi_bool:
+ */
+              __pyx_t_18 = (__pyx_v_bbpi_bool != 0);
+              if (__pyx_t_18) {
+
+                /* "qmeq/approach/elph/c_redfield.pyx":147
+ *                             kern[bbp, bbppi] = kern[bbp, bbppi] + fct_bbpp.real*bbpp_sgn
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, bbppi] = kern[bbpi, bbppi] + fct_bbpp.imag*bbpp_sgn             # <<<<<<<<<<<<<<
+ *                         if bbpi_bool:
+ *                             kern[bbpi, bbpp] = kern[bbpi, bbpp] - fct_bbpp.real
+ */
+                __pyx_t_44 = __pyx_v_bbpi;
+                __pyx_t_43 = __pyx_v_bbppi;
+                if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_kern.diminfo[0].shape;
+                if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_kern.diminfo[1].shape;
+                __pyx_t_41 = __pyx_v_bbpi;
+                __pyx_t_40 = __pyx_v_bbppi;
+                if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_kern.diminfo[0].shape;
+                if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_kern.diminfo[1].shape;
+                *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_40, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_43, __pyx_pybuffernd_kern.diminfo[1].strides)) + (__Pyx_CIMAG(__pyx_v_fct_bbpp) * __pyx_v_bbpp_sgn));
+
+                /* "qmeq/approach/elph/c_redfield.pyx":146
+ *                         if bbppi >= ndm0:
+ *                             kern[bbp, bbppi] = kern[bbp, bbppi] + fct_bbpp.real*bbpp_sgn
+ *                             if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                                 kern[bbpi, bbppi] = kern[bbpi, bbppi] + fct_bbpp.imag*bbpp_sgn
+ *                         if bbpi_bool:
+ */
+              }
+
+              /* "qmeq/approach/elph/c_redfield.pyx":144
+ *                         bbpp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[b] + dictdm[bpp] + shiftlst0[charge]] else -1
+ *                         kern[bbp, bbpp] = kern[bbp, bbpp] + fct_bbpp.imag
+ *                         if bbppi >= ndm0:             # <<<<<<<<<<<<<<
+ *                             kern[bbp, bbppi] = kern[bbp, bbppi] + fct_bbpp.real*bbpp_sgn
+ *                             if bbpi_bool:
+ */
+            }
+
+            /* "qmeq/approach/elph/c_redfield.pyx":148
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, bbppi] = kern[bbpi, bbppi] + fct_bbpp.imag*bbpp_sgn
+ *                         if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                             kern[bbpi, bbpp] = kern[bbpi, bbpp] - fct_bbpp.real
+ *                 # --------------------------------------------------
+ */
+            __pyx_t_18 = (__pyx_v_bbpi_bool != 0);
+            if (__pyx_t_18) {
+
+              /* "qmeq/approach/elph/c_redfield.pyx":149
+ *                                 kern[bbpi, bbppi] = kern[bbpi, bbppi] + fct_bbpp.imag*bbpp_sgn
+ *                         if bbpi_bool:
+ *                             kern[bbpi, bbpp] = kern[bbpi, bbpp] - fct_bbpp.real             # <<<<<<<<<<<<<<
+ *                 # --------------------------------------------------
+ *                 for c, cp in itertools.product(si.statesdm[charge], si.statesdm[charge]):
+ */
+              __pyx_t_43 = __pyx_v_bbpi;
+              __pyx_t_44 = __pyx_v_bbpp;
+              if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              __pyx_t_40 = __pyx_v_bbpi;
+              __pyx_t_41 = __pyx_v_bbpp;
+              if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_40, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_41, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_44, __pyx_pybuffernd_kern.diminfo[1].strides)) - __Pyx_CREAL(__pyx_v_fct_bbpp));
+
+              /* "qmeq/approach/elph/c_redfield.pyx":148
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, bbppi] = kern[bbpi, bbppi] + fct_bbpp.imag*bbpp_sgn
+ *                         if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                             kern[bbpi, bbpp] = kern[bbpi, bbpp] - fct_bbpp.real
+ *                 # --------------------------------------------------
+ */
+            }
+
+            /* "qmeq/approach/elph/c_redfield.pyx":127
+ *                     # --------------------------------------------------
+ *                     bbpp = mapdm0[lenlst[charge]*dictdm[b] + dictdm[bpp] + shiftlst0[charge]]
+ *                     if bbpp != -1:             # <<<<<<<<<<<<<<
+ *                         fct_bbpp = 0
+ *                         for a in si.statesdm[charge]:
+ */
+          }
+
+          /* "qmeq/approach/elph/c_redfield.pyx":100
+ *                             kern[bbpi, aap] = kern[bbpi, aap] - fct_aap.real
+ *                 # --------------------------------------------------
+ *                 for bpp in si.statesdm[charge]:             # <<<<<<<<<<<<<<
+ *                     bppbp = mapdm0[lenlst[charge]*dictdm[bpp] + dictdm[bp] + shiftlst0[charge]]
+ *                     if bppbp != -1:
+ */
+        }
+        __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+
+        /* "qmeq/approach/elph/c_redfield.pyx":151
+ *                             kern[bbpi, bbpp] = kern[bbpi, bbpp] - fct_bbpp.real
+ *                 # --------------------------------------------------
+ *                 for c, cp in itertools.product(si.statesdm[charge], si.statesdm[charge]):             # <<<<<<<<<<<<<<
+ *                     ccp = mapdm0[lenlst[charge]*dictdm[c] + dictdm[cp] + shiftlst0[charge]]
+ *                     if ccp != -1:
+ */
+        __Pyx_GetModuleGlobalName(__pyx_t_20, __pyx_n_s_itertools); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 151, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_20);
+        __pyx_t_31 = __Pyx_PyObject_GetAttrStr(__pyx_t_20, __pyx_n_s_product); if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 151, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_31);
+        __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+        __pyx_t_20 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_statesdm); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 151, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_20);
+        __pyx_t_32 = __Pyx_GetItemInt(__pyx_t_20, __pyx_v_charge, __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t, 1, __Pyx_PyInt_From_npy_long, 0, 1, 0); if (unlikely(!__pyx_t_32)) __PYX_ERR(0, 151, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_32);
+        __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+        __pyx_t_20 = __Pyx_PyObject_GetAttrStr(__pyx_v_si, __pyx_n_s_statesdm); if (unlikely(!__pyx_t_20)) __PYX_ERR(0, 151, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_20);
+        __pyx_t_2 = __Pyx_GetItemInt(__pyx_t_20, __pyx_v_charge, __pyx_t_4qmeq_8approach_4elph_10c_redfield_int_t, 1, __Pyx_PyInt_From_npy_long, 0, 1, 0); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 151, __pyx_L1_error)
+        __Pyx_GOTREF(__pyx_t_2);
+        __Pyx_DECREF(__pyx_t_20); __pyx_t_20 = 0;
+        __pyx_t_20 = NULL;
+        __pyx_t_21 = 0;
+        if (CYTHON_UNPACK_METHODS && unlikely(PyMethod_Check(__pyx_t_31))) {
+          __pyx_t_20 = PyMethod_GET_SELF(__pyx_t_31);
+          if (likely(__pyx_t_20)) {
+            PyObject* function = PyMethod_GET_FUNCTION(__pyx_t_31);
+            __Pyx_INCREF(__pyx_t_20);
+            __Pyx_INCREF(function);
+            __Pyx_DECREF_SET(__pyx_t_31, function);
+            __pyx_t_21 = 1;
+          }
+        }
+        #if CYTHON_FAST_PYCALL
+        if (PyFunction_Check(__pyx_t_31)) {
+          PyObject *__pyx_temp[3] = {__pyx_t_20, __pyx_t_32, __pyx_t_2};
+          __pyx_t_1 = __Pyx_PyFunction_FastCall(__pyx_t_31, __pyx_temp+1-__pyx_t_21, 2+__pyx_t_21); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 151, __pyx_L1_error)
+          __Pyx_XDECREF(__pyx_t_20); __pyx_t_20 = 0;
+          __Pyx_GOTREF(__pyx_t_1);
+          __Pyx_DECREF(__pyx_t_32); __pyx_t_32 = 0;
+          __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+        } else
+        #endif
+        #if CYTHON_FAST_PYCCALL
+        if (__Pyx_PyFastCFunction_Check(__pyx_t_31)) {
+          PyObject *__pyx_temp[3] = {__pyx_t_20, __pyx_t_32, __pyx_t_2};
+          __pyx_t_1 = __Pyx_PyCFunction_FastCall(__pyx_t_31, __pyx_temp+1-__pyx_t_21, 2+__pyx_t_21); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 151, __pyx_L1_error)
+          __Pyx_XDECREF(__pyx_t_20); __pyx_t_20 = 0;
+          __Pyx_GOTREF(__pyx_t_1);
+          __Pyx_DECREF(__pyx_t_32); __pyx_t_32 = 0;
+          __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+        } else
+        #endif
+        {
+          __pyx_t_19 = PyTuple_New(2+__pyx_t_21); if (unlikely(!__pyx_t_19)) __PYX_ERR(0, 151, __pyx_L1_error)
+          __Pyx_GOTREF(__pyx_t_19);
+          if (__pyx_t_20) {
+            __Pyx_GIVEREF(__pyx_t_20); PyTuple_SET_ITEM(__pyx_t_19, 0, __pyx_t_20); __pyx_t_20 = NULL;
+          }
+          __Pyx_GIVEREF(__pyx_t_32);
+          PyTuple_SET_ITEM(__pyx_t_19, 0+__pyx_t_21, __pyx_t_32);
+          __Pyx_GIVEREF(__pyx_t_2);
+          PyTuple_SET_ITEM(__pyx_t_19, 1+__pyx_t_21, __pyx_t_2);
+          __pyx_t_32 = 0;
+          __pyx_t_2 = 0;
+          __pyx_t_1 = __Pyx_PyObject_Call(__pyx_t_31, __pyx_t_19, NULL); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 151, __pyx_L1_error)
+          __Pyx_GOTREF(__pyx_t_1);
+          __Pyx_DECREF(__pyx_t_19); __pyx_t_19 = 0;
+        }
+        __Pyx_DECREF(__pyx_t_31); __pyx_t_31 = 0;
+        if (likely(PyList_CheckExact(__pyx_t_1)) || PyTuple_CheckExact(__pyx_t_1)) {
+          __pyx_t_31 = __pyx_t_1; __Pyx_INCREF(__pyx_t_31); __pyx_t_33 = 0;
+          __pyx_t_34 = NULL;
+        } else {
+          __pyx_t_33 = -1; __pyx_t_31 = PyObject_GetIter(__pyx_t_1); if (unlikely(!__pyx_t_31)) __PYX_ERR(0, 151, __pyx_L1_error)
+          __Pyx_GOTREF(__pyx_t_31);
+          __pyx_t_34 = Py_TYPE(__pyx_t_31)->tp_iternext; if (unlikely(!__pyx_t_34)) __PYX_ERR(0, 151, __pyx_L1_error)
+        }
+        __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+        for (;;) {
+          if (likely(!__pyx_t_34)) {
+            if (likely(PyList_CheckExact(__pyx_t_31))) {
+              if (__pyx_t_33 >= PyList_GET_SIZE(__pyx_t_31)) break;
+              #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+              __pyx_t_1 = PyList_GET_ITEM(__pyx_t_31, __pyx_t_33); __Pyx_INCREF(__pyx_t_1); __pyx_t_33++; if (unlikely(0 < 0)) __PYX_ERR(0, 151, __pyx_L1_error)
+              #else
+              __pyx_t_1 = PySequence_ITEM(__pyx_t_31, __pyx_t_33); __pyx_t_33++; if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 151, __pyx_L1_error)
+              __Pyx_GOTREF(__pyx_t_1);
+              #endif
+            } else {
+              if (__pyx_t_33 >= PyTuple_GET_SIZE(__pyx_t_31)) break;
+              #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+              __pyx_t_1 = PyTuple_GET_ITEM(__pyx_t_31, __pyx_t_33); __Pyx_INCREF(__pyx_t_1); __pyx_t_33++; if (unlikely(0 < 0)) __PYX_ERR(0, 151, __pyx_L1_error)
+              #else
+              __pyx_t_1 = PySequence_ITEM(__pyx_t_31, __pyx_t_33); __pyx_t_33++; if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 151, __pyx_L1_error)
+              __Pyx_GOTREF(__pyx_t_1);
+              #endif
+            }
+          } else {
+            __pyx_t_1 = __pyx_t_34(__pyx_t_31);
+            if (unlikely(!__pyx_t_1)) {
+              PyObject* exc_type = PyErr_Occurred();
+              if (exc_type) {
+                if (likely(__Pyx_PyErr_GivenExceptionMatches(exc_type, PyExc_StopIteration))) PyErr_Clear();
+                else __PYX_ERR(0, 151, __pyx_L1_error)
+              }
+              break;
+            }
+            __Pyx_GOTREF(__pyx_t_1);
+          }
+          if ((likely(PyTuple_CheckExact(__pyx_t_1))) || (PyList_CheckExact(__pyx_t_1))) {
+            PyObject* sequence = __pyx_t_1;
+            Py_ssize_t size = __Pyx_PySequence_SIZE(sequence);
+            if (unlikely(size != 2)) {
+              if (size > 2) __Pyx_RaiseTooManyValuesError(2);
+              else if (size >= 0) __Pyx_RaiseNeedMoreValuesError(size);
+              __PYX_ERR(0, 151, __pyx_L1_error)
+            }
+            #if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+            if (likely(PyTuple_CheckExact(sequence))) {
+              __pyx_t_19 = PyTuple_GET_ITEM(sequence, 0); 
+              __pyx_t_2 = PyTuple_GET_ITEM(sequence, 1); 
+            } else {
+              __pyx_t_19 = PyList_GET_ITEM(sequence, 0); 
+              __pyx_t_2 = PyList_GET_ITEM(sequence, 1); 
+            }
+            __Pyx_INCREF(__pyx_t_19);
+            __Pyx_INCREF(__pyx_t_2);
+            #else
+            __pyx_t_19 = PySequence_ITEM(sequence, 0); if (unlikely(!__pyx_t_19)) __PYX_ERR(0, 151, __pyx_L1_error)
+            __Pyx_GOTREF(__pyx_t_19);
+            __pyx_t_2 = PySequence_ITEM(sequence, 1); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 151, __pyx_L1_error)
+            __Pyx_GOTREF(__pyx_t_2);
+            #endif
+            __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+          } else {
+            Py_ssize_t index = -1;
+            __pyx_t_32 = PyObject_GetIter(__pyx_t_1); if (unlikely(!__pyx_t_32)) __PYX_ERR(0, 151, __pyx_L1_error)
+            __Pyx_GOTREF(__pyx_t_32);
+            __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+            __pyx_t_28 = Py_TYPE(__pyx_t_32)->tp_iternext;
+            index = 0; __pyx_t_19 = __pyx_t_28(__pyx_t_32); if (unlikely(!__pyx_t_19)) goto __pyx_L51_unpacking_failed;
+            __Pyx_GOTREF(__pyx_t_19);
+            index = 1; __pyx_t_2 = __pyx_t_28(__pyx_t_32); if (unlikely(!__pyx_t_2)) goto __pyx_L51_unpacking_failed;
+            __Pyx_GOTREF(__pyx_t_2);
+            if (__Pyx_IternextUnpackEndCheck(__pyx_t_28(__pyx_t_32), 2) < 0) __PYX_ERR(0, 151, __pyx_L1_error)
+            __pyx_t_28 = NULL;
+            __Pyx_DECREF(__pyx_t_32); __pyx_t_32 = 0;
+            goto __pyx_L52_unpacking_done;
+            __pyx_L51_unpacking_failed:;
+            __Pyx_DECREF(__pyx_t_32); __pyx_t_32 = 0;
+            __pyx_t_28 = NULL;
+            if (__Pyx_IterFinish() == 0) __Pyx_RaiseNeedMoreValuesError(index);
+            __PYX_ERR(0, 151, __pyx_L1_error)
+            __pyx_L52_unpacking_done:;
+          }
+          __pyx_t_44 = __Pyx_PyInt_As_npy_int64(__pyx_t_19); if (unlikely((__pyx_t_44 == ((npy_int64)-1)) && PyErr_Occurred())) __PYX_ERR(0, 151, __pyx_L1_error)
+          __Pyx_DECREF(__pyx_t_19); __pyx_t_19 = 0;
+          __pyx_t_43 = __Pyx_PyInt_As_npy_int64(__pyx_t_2); if (unlikely((__pyx_t_43 == ((npy_int64)-1)) && PyErr_Occurred())) __PYX_ERR(0, 151, __pyx_L1_error)
+          __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+          __pyx_v_c = __pyx_t_44;
+          __pyx_v_cp = __pyx_t_43;
+
+          /* "qmeq/approach/elph/c_redfield.pyx":152
+ *                 # --------------------------------------------------
+ *                 for c, cp in itertools.product(si.statesdm[charge], si.statesdm[charge]):
+ *                     ccp = mapdm0[lenlst[charge]*dictdm[c] + dictdm[cp] + shiftlst0[charge]]             # <<<<<<<<<<<<<<
+ *                     if ccp != -1:
+ *                         cpbp = mapdm0_[lenlst[charge]*dictdm[cp] + dictdm[bp] + shiftlst0[charge]]
+ */
+          __pyx_t_29 = __pyx_v_charge;
+          if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+          __pyx_t_43 = __pyx_v_c;
+          if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+          __pyx_t_44 = __pyx_v_cp;
+          if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+          __pyx_t_30 = __pyx_v_charge;
+          if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+          __pyx_t_41 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+          if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_mapdm0.diminfo[0].shape;
+          __pyx_v_ccp = (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_mapdm0.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_mapdm0.diminfo[0].strides));
+
+          /* "qmeq/approach/elph/c_redfield.pyx":153
+ *                 for c, cp in itertools.product(si.statesdm[charge], si.statesdm[charge]):
+ *                     ccp = mapdm0[lenlst[charge]*dictdm[c] + dictdm[cp] + shiftlst0[charge]]
+ *                     if ccp != -1:             # <<<<<<<<<<<<<<
+ *                         cpbp = mapdm0_[lenlst[charge]*dictdm[cp] + dictdm[bp] + shiftlst0[charge]]
+ *                         cb = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[b] + shiftlst0[charge]]
+ */
+          __pyx_t_18 = ((__pyx_v_ccp != -1LL) != 0);
+          if (__pyx_t_18) {
+
+            /* "qmeq/approach/elph/c_redfield.pyx":154
+ *                     ccp = mapdm0[lenlst[charge]*dictdm[c] + dictdm[cp] + shiftlst0[charge]]
+ *                     if ccp != -1:
+ *                         cpbp = mapdm0_[lenlst[charge]*dictdm[cp] + dictdm[bp] + shiftlst0[charge]]             # <<<<<<<<<<<<<<
+ *                         cb = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[b] + shiftlst0[charge]]
+ *                         fct_ccp = 0
+ */
+            __pyx_t_30 = __pyx_v_charge;
+            if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+            __pyx_t_44 = __pyx_v_cp;
+            if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_43 = __pyx_v_bp;
+            if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_29 = __pyx_v_charge;
+            if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+            __pyx_t_41 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+            if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_mapdm0_.diminfo[0].shape;
+            __pyx_v_cpbp = (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_mapdm0_.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_mapdm0_.diminfo[0].strides));
+
+            /* "qmeq/approach/elph/c_redfield.pyx":155
+ *                     if ccp != -1:
+ *                         cpbp = mapdm0_[lenlst[charge]*dictdm[cp] + dictdm[bp] + shiftlst0[charge]]
+ *                         cb = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[b] + shiftlst0[charge]]             # <<<<<<<<<<<<<<
+ *                         fct_ccp = 0
+ *                         for l in range(nbaths):
+ */
+            __pyx_t_29 = __pyx_v_charge;
+            if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+            __pyx_t_43 = __pyx_v_c;
+            if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_44 = __pyx_v_b;
+            if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_30 = __pyx_v_charge;
+            if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+            __pyx_t_41 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_43, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_44, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+            if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_mapdm0_.diminfo[0].shape;
+            __pyx_v_cb = (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_mapdm0_.rcbuffer->pybuffer.buf, __pyx_t_41, __pyx_pybuffernd_mapdm0_.diminfo[0].strides));
+
+            /* "qmeq/approach/elph/c_redfield.pyx":156
+ *                         cpbp = mapdm0_[lenlst[charge]*dictdm[cp] + dictdm[bp] + shiftlst0[charge]]
+ *                         cb = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[b] + shiftlst0[charge]]
+ *                         fct_ccp = 0             # <<<<<<<<<<<<<<
+ *                         for l in range(nbaths):
+ *                             gamma_bc_bpcp = 0.5*(Vbbp[l, b, c]*Vbbp[l, bp, cp].conjugate() +
+ */
+            __pyx_v_fct_ccp = __pyx_t_double_complex_from_parts(0, 0);
+
+            /* "qmeq/approach/elph/c_redfield.pyx":157
+ *                         cb = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[b] + shiftlst0[charge]]
+ *                         fct_ccp = 0
+ *                         for l in range(nbaths):             # <<<<<<<<<<<<<<
+ *                             gamma_bc_bpcp = 0.5*(Vbbp[l, b, c]*Vbbp[l, bp, cp].conjugate() +
+ *                                                  Vbbp[l, c, b].conjugate()*Vbbp[l, cp, bp])
+ */
+            __pyx_t_35 = __pyx_v_nbaths;
+            __pyx_t_36 = __pyx_t_35;
+            for (__pyx_t_37 = 0; __pyx_t_37 < __pyx_t_36; __pyx_t_37+=1) {
+              __pyx_v_l = __pyx_t_37;
+
+              /* "qmeq/approach/elph/c_redfield.pyx":158
+ *                         fct_ccp = 0
+ *                         for l in range(nbaths):
+ *                             gamma_bc_bpcp = 0.5*(Vbbp[l, b, c]*Vbbp[l, bp, cp].conjugate() +             # <<<<<<<<<<<<<<
+ *                                                  Vbbp[l, c, b].conjugate()*Vbbp[l, cp, bp])
+ *                             fct_ccp += gamma_bc_bpcp*(w1fct[l, cpbp, 1] - w1fct[l, cb, 1].conjugate())
+ */
+              __pyx_t_30 = __pyx_v_l;
+              __pyx_t_44 = __pyx_v_b;
+              __pyx_t_43 = __pyx_v_c;
+              if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+              if (__pyx_t_44 < 0) __pyx_t_44 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+              if (__pyx_t_43 < 0) __pyx_t_43 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+              __pyx_t_29 = __pyx_v_l;
+              __pyx_t_41 = __pyx_v_bp;
+              __pyx_t_40 = __pyx_v_cp;
+              if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+              if (__pyx_t_41 < 0) __pyx_t_41 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+              if (__pyx_t_40 < 0) __pyx_t_40 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+
+              /* "qmeq/approach/elph/c_redfield.pyx":159
+ *                         for l in range(nbaths):
+ *                             gamma_bc_bpcp = 0.5*(Vbbp[l, b, c]*Vbbp[l, bp, cp].conjugate() +
+ *                                                  Vbbp[l, c, b].conjugate()*Vbbp[l, cp, bp])             # <<<<<<<<<<<<<<
+ *                             fct_ccp += gamma_bc_bpcp*(w1fct[l, cpbp, 1] - w1fct[l, cb, 1].conjugate())
+ *                         ccpi = ndm0 + ccp - npauli
+ */
+              __pyx_t_39 = __pyx_v_l;
+              __pyx_t_38 = __pyx_v_c;
+              __pyx_t_13 = __pyx_v_b;
+              if (__pyx_t_39 < 0) __pyx_t_39 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+              if (__pyx_t_38 < 0) __pyx_t_38 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+              if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+              __pyx_t_42 = __pyx_v_l;
+              __pyx_t_15 = __pyx_v_cp;
+              __pyx_t_14 = __pyx_v_bp;
+              if (__pyx_t_42 < 0) __pyx_t_42 += __pyx_pybuffernd_Vbbp.diminfo[0].shape;
+              if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_Vbbp.diminfo[1].shape;
+              if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_Vbbp.diminfo[2].shape;
+
+              /* "qmeq/approach/elph/c_redfield.pyx":158
+ *                         fct_ccp = 0
+ *                         for l in range(nbaths):
+ *                             gamma_bc_bpcp = 0.5*(Vbbp[l, b, c]*Vbbp[l, bp, cp].conjugate() +             # <<<<<<<<<<<<<<
+ *                                                  Vbbp[l, c, b].conjugate()*Vbbp[l, cp, bp])
+ *                             fct_ccp += gamma_bc_bpcp*(w1fct[l, cpbp, 1] - w1fct[l, cb, 1].conjugate())
+ */
+              __pyx_v_gamma_bc_bpcp = __Pyx_c_prod_double(__pyx_t_double_complex_from_parts(0.5, 0), __Pyx_c_sum_double(__Pyx_c_prod_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_44, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_43, __pyx_pybuffernd_Vbbp.diminfo[2].strides)), __Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_41, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_40, __pyx_pybuffernd_Vbbp.diminfo[2].strides)))), __Pyx_c_prod_double(__Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_39, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_38, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_13, __pyx_pybuffernd_Vbbp.diminfo[2].strides))), (*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_Vbbp.rcbuffer->pybuffer.buf, __pyx_t_42, __pyx_pybuffernd_Vbbp.diminfo[0].strides, __pyx_t_15, __pyx_pybuffernd_Vbbp.diminfo[1].strides, __pyx_t_14, __pyx_pybuffernd_Vbbp.diminfo[2].strides)))));
+
+              /* "qmeq/approach/elph/c_redfield.pyx":160
+ *                             gamma_bc_bpcp = 0.5*(Vbbp[l, b, c]*Vbbp[l, bp, cp].conjugate() +
+ *                                                  Vbbp[l, c, b].conjugate()*Vbbp[l, cp, bp])
+ *                             fct_ccp += gamma_bc_bpcp*(w1fct[l, cpbp, 1] - w1fct[l, cb, 1].conjugate())             # <<<<<<<<<<<<<<
+ *                         ccpi = ndm0 + ccp - npauli
+ *                         ccp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[c] + dictdm[cp] + shiftlst0[charge]] else -1
+ */
+              __pyx_t_42 = __pyx_v_l;
+              __pyx_t_14 = __pyx_v_cpbp;
+              __pyx_t_39 = 1;
+              if (__pyx_t_42 < 0) __pyx_t_42 += __pyx_pybuffernd_w1fct.diminfo[0].shape;
+              if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_w1fct.diminfo[1].shape;
+              if (__pyx_t_39 < 0) __pyx_t_39 += __pyx_pybuffernd_w1fct.diminfo[2].shape;
+              __pyx_t_29 = __pyx_v_l;
+              __pyx_t_15 = __pyx_v_cb;
+              __pyx_t_30 = 1;
+              if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_w1fct.diminfo[0].shape;
+              if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_w1fct.diminfo[1].shape;
+              if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_w1fct.diminfo[2].shape;
+              __pyx_v_fct_ccp = __Pyx_c_sum_double(__pyx_v_fct_ccp, __Pyx_c_prod_double(__pyx_v_gamma_bc_bpcp, __Pyx_c_diff_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_w1fct.rcbuffer->pybuffer.buf, __pyx_t_42, __pyx_pybuffernd_w1fct.diminfo[0].strides, __pyx_t_14, __pyx_pybuffernd_w1fct.diminfo[1].strides, __pyx_t_39, __pyx_pybuffernd_w1fct.diminfo[2].strides)), __Pyx_c_conj_double((*__Pyx_BufPtrStrided3d(__pyx_t_double_complex *, __pyx_pybuffernd_w1fct.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_w1fct.diminfo[0].strides, __pyx_t_15, __pyx_pybuffernd_w1fct.diminfo[1].strides, __pyx_t_30, __pyx_pybuffernd_w1fct.diminfo[2].strides))))));
+            }
+
+            /* "qmeq/approach/elph/c_redfield.pyx":161
+ *                                                  Vbbp[l, c, b].conjugate()*Vbbp[l, cp, bp])
+ *                             fct_ccp += gamma_bc_bpcp*(w1fct[l, cpbp, 1] - w1fct[l, cb, 1].conjugate())
+ *                         ccpi = ndm0 + ccp - npauli             # <<<<<<<<<<<<<<
+ *                         ccp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[c] + dictdm[cp] + shiftlst0[charge]] else -1
+ *                         kern[bbp, ccp] = kern[bbp, ccp] + fct_ccp.imag
+ */
+            __pyx_v_ccpi = ((__pyx_v_ndm0 + __pyx_v_ccp) - __pyx_v_npauli);
+
+            /* "qmeq/approach/elph/c_redfield.pyx":162
+ *                             fct_ccp += gamma_bc_bpcp*(w1fct[l, cpbp, 1] - w1fct[l, cb, 1].conjugate())
+ *                         ccpi = ndm0 + ccp - npauli
+ *                         ccp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[c] + dictdm[cp] + shiftlst0[charge]] else -1             # <<<<<<<<<<<<<<
+ *                         kern[bbp, ccp] = kern[bbp, ccp] + fct_ccp.imag
+ *                         if ccpi >= ndm0:
+ */
+            __pyx_t_30 = __pyx_v_charge;
+            if (__pyx_t_30 < 0) __pyx_t_30 += __pyx_pybuffernd_lenlst.diminfo[0].shape;
+            __pyx_t_15 = __pyx_v_c;
+            if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_14 = __pyx_v_cp;
+            if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_dictdm.diminfo[0].shape;
+            __pyx_t_29 = __pyx_v_charge;
+            if (__pyx_t_29 < 0) __pyx_t_29 += __pyx_pybuffernd_shiftlst0.diminfo[0].shape;
+            __pyx_t_13 = ((((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_lenlst.rcbuffer->pybuffer.buf, __pyx_t_30, __pyx_pybuffernd_lenlst.diminfo[0].strides)) * (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_15, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_dictdm.rcbuffer->pybuffer.buf, __pyx_t_14, __pyx_pybuffernd_dictdm.diminfo[0].strides))) + (*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_long_t *, __pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer.buf, __pyx_t_29, __pyx_pybuffernd_shiftlst0.diminfo[0].strides)));
+            if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_conjdm0.diminfo[0].shape;
+            if (((*__Pyx_BufPtrStrided1d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_bool_t *, __pyx_pybuffernd_conjdm0.rcbuffer->pybuffer.buf, __pyx_t_13, __pyx_pybuffernd_conjdm0.diminfo[0].strides)) != 0)) {
+              __pyx_t_35 = 1;
+            } else {
+              __pyx_t_35 = -1L;
+            }
+            __pyx_v_ccp_sgn = __pyx_t_35;
+
+            /* "qmeq/approach/elph/c_redfield.pyx":163
+ *                         ccpi = ndm0 + ccp - npauli
+ *                         ccp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[c] + dictdm[cp] + shiftlst0[charge]] else -1
+ *                         kern[bbp, ccp] = kern[bbp, ccp] + fct_ccp.imag             # <<<<<<<<<<<<<<
+ *                         if ccpi >= ndm0:
+ *                             kern[bbp, ccpi] = kern[bbp, ccpi] + fct_ccp.real*ccp_sgn
+ */
+            __pyx_t_14 = __pyx_v_bbp;
+            __pyx_t_15 = __pyx_v_ccp;
+            if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_kern.diminfo[0].shape;
+            if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_kern.diminfo[1].shape;
+            __pyx_t_13 = __pyx_v_bbp;
+            __pyx_t_38 = __pyx_v_ccp;
+            if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_kern.diminfo[0].shape;
+            if (__pyx_t_38 < 0) __pyx_t_38 += __pyx_pybuffernd_kern.diminfo[1].shape;
+            *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_13, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_38, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_14, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_15, __pyx_pybuffernd_kern.diminfo[1].strides)) + __Pyx_CIMAG(__pyx_v_fct_ccp));
+
+            /* "qmeq/approach/elph/c_redfield.pyx":164
+ *                         ccp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[c] + dictdm[cp] + shiftlst0[charge]] else -1
+ *                         kern[bbp, ccp] = kern[bbp, ccp] + fct_ccp.imag
+ *                         if ccpi >= ndm0:             # <<<<<<<<<<<<<<
+ *                             kern[bbp, ccpi] = kern[bbp, ccpi] + fct_ccp.real*ccp_sgn
+ *                             if bbpi_bool:
+ */
+            __pyx_t_18 = ((__pyx_v_ccpi >= __pyx_v_ndm0) != 0);
+            if (__pyx_t_18) {
+
+              /* "qmeq/approach/elph/c_redfield.pyx":165
+ *                         kern[bbp, ccp] = kern[bbp, ccp] + fct_ccp.imag
+ *                         if ccpi >= ndm0:
+ *                             kern[bbp, ccpi] = kern[bbp, ccpi] + fct_ccp.real*ccp_sgn             # <<<<<<<<<<<<<<
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, ccpi] = kern[bbpi, ccpi] + fct_ccp.imag*ccp_sgn
+ */
+              __pyx_t_15 = __pyx_v_bbp;
+              __pyx_t_14 = __pyx_v_ccpi;
+              if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              __pyx_t_38 = __pyx_v_bbp;
+              __pyx_t_13 = __pyx_v_ccpi;
+              if (__pyx_t_38 < 0) __pyx_t_38 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_38, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_13, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_15, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_14, __pyx_pybuffernd_kern.diminfo[1].strides)) + (__Pyx_CREAL(__pyx_v_fct_ccp) * __pyx_v_ccp_sgn));
+
+              /* "qmeq/approach/elph/c_redfield.pyx":166
+ *                         if ccpi >= ndm0:
+ *                             kern[bbp, ccpi] = kern[bbp, ccpi] + fct_ccp.real*ccp_sgn
+ *                             if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                                 kern[bbpi, ccpi] = kern[bbpi, ccpi] + fct_ccp.imag*ccp_sgn
+ *                         if bbpi_bool:
+ */
+              __pyx_t_18 = (__pyx_v_bbpi_bool != 0);
+              if (__pyx_t_18) {
+
+                /* "qmeq/approach/elph/c_redfield.pyx":167
+ *                             kern[bbp, ccpi] = kern[bbp, ccpi] + fct_ccp.real*ccp_sgn
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, ccpi] = kern[bbpi, ccpi] + fct_ccp.imag*ccp_sgn             # <<<<<<<<<<<<<<
+ *                         if bbpi_bool:
+ *                             kern[bbpi, ccp] = kern[bbpi, ccp] - fct_ccp.real
+ */
+                __pyx_t_14 = __pyx_v_bbpi;
+                __pyx_t_15 = __pyx_v_ccpi;
+                if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_kern.diminfo[0].shape;
+                if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_kern.diminfo[1].shape;
+                __pyx_t_13 = __pyx_v_bbpi;
+                __pyx_t_38 = __pyx_v_ccpi;
+                if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_kern.diminfo[0].shape;
+                if (__pyx_t_38 < 0) __pyx_t_38 += __pyx_pybuffernd_kern.diminfo[1].shape;
+                *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_13, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_38, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_14, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_15, __pyx_pybuffernd_kern.diminfo[1].strides)) + (__Pyx_CIMAG(__pyx_v_fct_ccp) * __pyx_v_ccp_sgn));
+
+                /* "qmeq/approach/elph/c_redfield.pyx":166
+ *                         if ccpi >= ndm0:
+ *                             kern[bbp, ccpi] = kern[bbp, ccpi] + fct_ccp.real*ccp_sgn
+ *                             if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                                 kern[bbpi, ccpi] = kern[bbpi, ccpi] + fct_ccp.imag*ccp_sgn
+ *                         if bbpi_bool:
+ */
+              }
+
+              /* "qmeq/approach/elph/c_redfield.pyx":164
+ *                         ccp_sgn = +1 if conjdm0[lenlst[charge]*dictdm[c] + dictdm[cp] + shiftlst0[charge]] else -1
+ *                         kern[bbp, ccp] = kern[bbp, ccp] + fct_ccp.imag
+ *                         if ccpi >= ndm0:             # <<<<<<<<<<<<<<
+ *                             kern[bbp, ccpi] = kern[bbp, ccpi] + fct_ccp.real*ccp_sgn
+ *                             if bbpi_bool:
+ */
+            }
+
+            /* "qmeq/approach/elph/c_redfield.pyx":168
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, ccpi] = kern[bbpi, ccpi] + fct_ccp.imag*ccp_sgn
+ *                         if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                             kern[bbpi, ccp] = kern[bbpi, ccp] - fct_ccp.real
+ *                 # --------------------------------------------------
+ */
+            __pyx_t_18 = (__pyx_v_bbpi_bool != 0);
+            if (__pyx_t_18) {
+
+              /* "qmeq/approach/elph/c_redfield.pyx":169
+ *                                 kern[bbpi, ccpi] = kern[bbpi, ccpi] + fct_ccp.imag*ccp_sgn
+ *                         if bbpi_bool:
+ *                             kern[bbpi, ccp] = kern[bbpi, ccp] - fct_ccp.real             # <<<<<<<<<<<<<<
+ *                 # --------------------------------------------------
+ *     return 0
+ */
+              __pyx_t_15 = __pyx_v_bbpi;
+              __pyx_t_14 = __pyx_v_ccp;
+              if (__pyx_t_15 < 0) __pyx_t_15 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_14 < 0) __pyx_t_14 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              __pyx_t_38 = __pyx_v_bbpi;
+              __pyx_t_13 = __pyx_v_ccp;
+              if (__pyx_t_38 < 0) __pyx_t_38 += __pyx_pybuffernd_kern.diminfo[0].shape;
+              if (__pyx_t_13 < 0) __pyx_t_13 += __pyx_pybuffernd_kern.diminfo[1].shape;
+              *__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_38, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_13, __pyx_pybuffernd_kern.diminfo[1].strides) = ((*__Pyx_BufPtrStrided2d(__pyx_t_4qmeq_8approach_4elph_10c_redfield_double_t *, __pyx_pybuffernd_kern.rcbuffer->pybuffer.buf, __pyx_t_15, __pyx_pybuffernd_kern.diminfo[0].strides, __pyx_t_14, __pyx_pybuffernd_kern.diminfo[1].strides)) - __Pyx_CREAL(__pyx_v_fct_ccp));
+
+              /* "qmeq/approach/elph/c_redfield.pyx":168
+ *                             if bbpi_bool:
+ *                                 kern[bbpi, ccpi] = kern[bbpi, ccpi] + fct_ccp.imag*ccp_sgn
+ *                         if bbpi_bool:             # <<<<<<<<<<<<<<
+ *                             kern[bbpi, ccp] = kern[bbpi, ccp] - fct_ccp.real
+ *                 # --------------------------------------------------
+ */
+            }
+
+            /* "qmeq/approach/elph/c_redfield.pyx":153
+ *                 for c, cp in itertools.product(si.statesdm[charge], si.statesdm[charge]):
+ *                     ccp = mapdm0[lenlst[charge]*dictdm[c] + dictdm[cp] + shiftlst0[charge]]
+ *                     if ccp != -1:             # <<<<<<<<<<<<<<
+ *                         cpbp = mapdm0_[lenlst[charge]*dictdm[cp] + dictdm[bp] + shiftlst0[charge]]
+ *                         cb = mapdm0_[lenlst[charge]*dictdm[c] + dictdm[b] + shiftlst0[charge]]
+ */
+          }
+
+          /* "qmeq/approach/elph/c_redfield.pyx":151
+ *                             kern[bbpi, bbpp] = kern[bbpi, bbpp] - fct_bbpp.real
+ *                 # --------------------------------------------------
+ *                 for c, cp in itertools.product(si.statesdm[charge], si.statesdm[charge]):             # <<<<<<<<<<<<<<
+ *                     ccp = mapdm0[lenlst[charge]*dictdm[c] + dictdm[cp] + shiftlst0[charge]]
+ *                     if ccp != -1:
+ */
+        }
+        __Pyx_DECREF(__pyx_t_31); __pyx_t_31 = 0;
+
+        /* "qmeq/approach/elph/c_redfield.pyx":76
+ *             bbp = mapdm0[lenlst[charge]*dictdm[b] + dictdm[bp] + shiftlst0[charge]]
+ *             bbp_bool = booldm0[lenlst[charge]*dictdm[b] + dictdm[bp] + shiftlst0[charge]]
+ *             if bbp != -1 and bbp_bool:             # <<<<<<<<<<<<<<
+ *                 bbpi = ndm0 + bbp - npauli
+ *                 bbpi_bool = True if bbpi >= ndm0 else False
+ */
+      }
+
+      /* "qmeq/approach/elph/c_redfield.pyx":73
+ *     cdef np.ndarray[double_t, ndim=2] kern = self.kern
+ *     for charge in range(si.ncharge):
+ *         for b, bp in itertools.combinations_with_replacement(si.statesdm[charge], 2):             # <<<<<<<<<<<<<<
+ *             bbp = mapdm0[lenlst[charge]*dictdm[b] + dictdm[bp] + shiftlst0[charge]]
+ *             bbp_bool = booldm0[lenlst[charge]*dictdm[b] + dictdm[bp] + shiftlst0[charge]]
+ */
+    }
+    __Pyx_DECREF(__pyx_t_22); __pyx_t_22 = 0;
+  }
+
+  /* "qmeq/approach/elph/c_redfield.pyx":171
+ *                             kern[bbpi, ccp] = kern[bbpi, ccp] - fct_ccp.real
+ *                 # --------------------------------------------------
+ *     return 0             # <<<<<<<<<<<<<<
+ * 
+ * 
+ */
+  __Pyx_XDECREF(__pyx_r);
+  __Pyx_INCREF(__pyx_int_0);
+  __pyx_r = __pyx_int_0;
+  goto __pyx_L0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":36
+ * # ---------------------------------------------------------------------------------------------------------
+ * @cython.boundscheck(False)
+ * def generate_kern_redfield_elph(self):             # <<<<<<<<<<<<<<
+ *     cdef np.ndarray[double_t, ndim=1] E = self.qd.Ea
+ *     cdef np.ndarray[complex_t, ndim=3] Vbbp = self.baths.Vbbp
+ */
+
+  /* function exit code */
+  __pyx_L1_error:;
+  __Pyx_XDECREF(__pyx_t_1);
+  __Pyx_XDECREF(__pyx_t_2);
+  __Pyx_XDECREF(__pyx_t_19);
+  __Pyx_XDECREF(__pyx_t_20);
+  __Pyx_XDECREF(__pyx_t_22);
+  __Pyx_XDECREF(__pyx_t_31);
+  __Pyx_XDECREF(__pyx_t_32);
+  { PyObject *__pyx_type, *__pyx_value, *__pyx_tb;
+    __Pyx_PyThreadState_declare
+    __Pyx_PyThreadState_assign
+    __Pyx_ErrFetch(&__pyx_type, &__pyx_value, &__pyx_tb);
+    __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_E.rcbuffer->pybuffer);
+    __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_Vbbp.rcbuffer->pybuffer);
+    __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_booldm0.rcbuffer->pybuffer);
+    __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_conjdm0.rcbuffer->pybuffer);
+    __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_dictdm.rcbuffer->pybuffer);
+    __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_kern.rcbuffer->pybuffer);
+    __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_lenlst.rcbuffer->pybuffer);
+    __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_mapdm0.rcbuffer->pybuffer);
+    __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_mapdm0_.rcbuffer->pybuffer);
+    __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer);
+    __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_w1fct.rcbuffer->pybuffer);
+  __Pyx_ErrRestore(__pyx_type, __pyx_value, __pyx_tb);}
+  __Pyx_AddTraceback("qmeq.approach.elph.c_redfield.generate_kern_redfield_elph", __pyx_clineno, __pyx_lineno, __pyx_filename);
+  __pyx_r = NULL;
+  goto __pyx_L2;
+  __pyx_L0:;
+  __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_E.rcbuffer->pybuffer);
+  __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_Vbbp.rcbuffer->pybuffer);
+  __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_booldm0.rcbuffer->pybuffer);
+  __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_conjdm0.rcbuffer->pybuffer);
+  __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_dictdm.rcbuffer->pybuffer);
+  __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_kern.rcbuffer->pybuffer);
+  __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_lenlst.rcbuffer->pybuffer);
+  __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_mapdm0.rcbuffer->pybuffer);
+  __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_mapdm0_.rcbuffer->pybuffer);
+  __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_shiftlst0.rcbuffer->pybuffer);
+  __Pyx_SafeReleaseBuffer(&__pyx_pybuffernd_w1fct.rcbuffer->pybuffer);
+  __pyx_L2:;
+  __Pyx_XDECREF((PyObject *)__pyx_v_E);
+  __Pyx_XDECREF((PyObject *)__pyx_v_Vbbp);
+  __Pyx_XDECREF((PyObject *)__pyx_v_w1fct);
+  __Pyx_XDECREF(__pyx_v_si);
+  __Pyx_XDECREF(__pyx_v_si_elph);
+  __Pyx_XDECREF((PyObject *)__pyx_v_lenlst);
+  __Pyx_XDECREF((PyObject *)__pyx_v_dictdm);
+  __Pyx_XDECREF((PyObject *)__pyx_v_shiftlst0);
+  __Pyx_XDECREF((PyObject *)__pyx_v_mapdm0);
+  __Pyx_XDECREF((PyObject *)__pyx_v_booldm0);
+  __Pyx_XDECREF((PyObject *)__pyx_v_conjdm0);
+  __Pyx_XDECREF((PyObject *)__pyx_v_mapdm0_);
+  __Pyx_XDECREF((PyObject *)__pyx_v_kern);
+  __Pyx_XGIVEREF(__pyx_r);
+  __Pyx_RefNannyFinishContext();
+  return __pyx_r;
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":734
+ * ctypedef npy_cdouble     complex_t
+ * 
+ * cdef inline object PyArray_MultiIterNew1(a):             # <<<<<<<<<<<<<<
+ *     return PyArray_MultiIterNew(1, <void*>a)
+ * 
+ */
+
+static CYTHON_INLINE PyObject *__pyx_f_5numpy_PyArray_MultiIterNew1(PyObject *__pyx_v_a) {
+  PyObject *__pyx_r = NULL;
+  __Pyx_RefNannyDeclarations
+  PyObject *__pyx_t_1 = NULL;
+  int __pyx_lineno = 0;
+  const char *__pyx_filename = NULL;
+  int __pyx_clineno = 0;
+  __Pyx_RefNannySetupContext("PyArray_MultiIterNew1", 0);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":735
+ * 
+ * cdef inline object PyArray_MultiIterNew1(a):
+ *     return PyArray_MultiIterNew(1, <void*>a)             # <<<<<<<<<<<<<<
+ * 
+ * cdef inline object PyArray_MultiIterNew2(a, b):
+ */
+  __Pyx_XDECREF(__pyx_r);
+  __pyx_t_1 = PyArray_MultiIterNew(1, ((void *)__pyx_v_a)); if (unlikely(!__pyx_t_1)) __PYX_ERR(1, 735, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __pyx_r = __pyx_t_1;
+  __pyx_t_1 = 0;
+  goto __pyx_L0;
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":734
+ * ctypedef npy_cdouble     complex_t
+ * 
+ * cdef inline object PyArray_MultiIterNew1(a):             # <<<<<<<<<<<<<<
+ *     return PyArray_MultiIterNew(1, <void*>a)
+ * 
+ */
+
+  /* function exit code */
+  __pyx_L1_error:;
+  __Pyx_XDECREF(__pyx_t_1);
+  __Pyx_AddTraceback("numpy.PyArray_MultiIterNew1", __pyx_clineno, __pyx_lineno, __pyx_filename);
+  __pyx_r = 0;
+  __pyx_L0:;
+  __Pyx_XGIVEREF(__pyx_r);
+  __Pyx_RefNannyFinishContext();
+  return __pyx_r;
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":737
+ *     return PyArray_MultiIterNew(1, <void*>a)
+ * 
+ * cdef inline object PyArray_MultiIterNew2(a, b):             # <<<<<<<<<<<<<<
+ *     return PyArray_MultiIterNew(2, <void*>a, <void*>b)
+ * 
+ */
+
+static CYTHON_INLINE PyObject *__pyx_f_5numpy_PyArray_MultiIterNew2(PyObject *__pyx_v_a, PyObject *__pyx_v_b) {
+  PyObject *__pyx_r = NULL;
+  __Pyx_RefNannyDeclarations
+  PyObject *__pyx_t_1 = NULL;
+  int __pyx_lineno = 0;
+  const char *__pyx_filename = NULL;
+  int __pyx_clineno = 0;
+  __Pyx_RefNannySetupContext("PyArray_MultiIterNew2", 0);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":738
+ * 
+ * cdef inline object PyArray_MultiIterNew2(a, b):
+ *     return PyArray_MultiIterNew(2, <void*>a, <void*>b)             # <<<<<<<<<<<<<<
+ * 
+ * cdef inline object PyArray_MultiIterNew3(a, b, c):
+ */
+  __Pyx_XDECREF(__pyx_r);
+  __pyx_t_1 = PyArray_MultiIterNew(2, ((void *)__pyx_v_a), ((void *)__pyx_v_b)); if (unlikely(!__pyx_t_1)) __PYX_ERR(1, 738, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __pyx_r = __pyx_t_1;
+  __pyx_t_1 = 0;
+  goto __pyx_L0;
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":737
+ *     return PyArray_MultiIterNew(1, <void*>a)
+ * 
+ * cdef inline object PyArray_MultiIterNew2(a, b):             # <<<<<<<<<<<<<<
+ *     return PyArray_MultiIterNew(2, <void*>a, <void*>b)
+ * 
+ */
+
+  /* function exit code */
+  __pyx_L1_error:;
+  __Pyx_XDECREF(__pyx_t_1);
+  __Pyx_AddTraceback("numpy.PyArray_MultiIterNew2", __pyx_clineno, __pyx_lineno, __pyx_filename);
+  __pyx_r = 0;
+  __pyx_L0:;
+  __Pyx_XGIVEREF(__pyx_r);
+  __Pyx_RefNannyFinishContext();
+  return __pyx_r;
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":740
+ *     return PyArray_MultiIterNew(2, <void*>a, <void*>b)
+ * 
+ * cdef inline object PyArray_MultiIterNew3(a, b, c):             # <<<<<<<<<<<<<<
+ *     return PyArray_MultiIterNew(3, <void*>a, <void*>b, <void*> c)
+ * 
+ */
+
+static CYTHON_INLINE PyObject *__pyx_f_5numpy_PyArray_MultiIterNew3(PyObject *__pyx_v_a, PyObject *__pyx_v_b, PyObject *__pyx_v_c) {
+  PyObject *__pyx_r = NULL;
+  __Pyx_RefNannyDeclarations
+  PyObject *__pyx_t_1 = NULL;
+  int __pyx_lineno = 0;
+  const char *__pyx_filename = NULL;
+  int __pyx_clineno = 0;
+  __Pyx_RefNannySetupContext("PyArray_MultiIterNew3", 0);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":741
+ * 
+ * cdef inline object PyArray_MultiIterNew3(a, b, c):
+ *     return PyArray_MultiIterNew(3, <void*>a, <void*>b, <void*> c)             # <<<<<<<<<<<<<<
+ * 
+ * cdef inline object PyArray_MultiIterNew4(a, b, c, d):
+ */
+  __Pyx_XDECREF(__pyx_r);
+  __pyx_t_1 = PyArray_MultiIterNew(3, ((void *)__pyx_v_a), ((void *)__pyx_v_b), ((void *)__pyx_v_c)); if (unlikely(!__pyx_t_1)) __PYX_ERR(1, 741, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __pyx_r = __pyx_t_1;
+  __pyx_t_1 = 0;
+  goto __pyx_L0;
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":740
+ *     return PyArray_MultiIterNew(2, <void*>a, <void*>b)
+ * 
+ * cdef inline object PyArray_MultiIterNew3(a, b, c):             # <<<<<<<<<<<<<<
+ *     return PyArray_MultiIterNew(3, <void*>a, <void*>b, <void*> c)
+ * 
+ */
+
+  /* function exit code */
+  __pyx_L1_error:;
+  __Pyx_XDECREF(__pyx_t_1);
+  __Pyx_AddTraceback("numpy.PyArray_MultiIterNew3", __pyx_clineno, __pyx_lineno, __pyx_filename);
+  __pyx_r = 0;
+  __pyx_L0:;
+  __Pyx_XGIVEREF(__pyx_r);
+  __Pyx_RefNannyFinishContext();
+  return __pyx_r;
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":743
+ *     return PyArray_MultiIterNew(3, <void*>a, <void*>b, <void*> c)
+ * 
+ * cdef inline object PyArray_MultiIterNew4(a, b, c, d):             # <<<<<<<<<<<<<<
+ *     return PyArray_MultiIterNew(4, <void*>a, <void*>b, <void*>c, <void*> d)
+ * 
+ */
+
+static CYTHON_INLINE PyObject *__pyx_f_5numpy_PyArray_MultiIterNew4(PyObject *__pyx_v_a, PyObject *__pyx_v_b, PyObject *__pyx_v_c, PyObject *__pyx_v_d) {
+  PyObject *__pyx_r = NULL;
+  __Pyx_RefNannyDeclarations
+  PyObject *__pyx_t_1 = NULL;
+  int __pyx_lineno = 0;
+  const char *__pyx_filename = NULL;
+  int __pyx_clineno = 0;
+  __Pyx_RefNannySetupContext("PyArray_MultiIterNew4", 0);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":744
+ * 
+ * cdef inline object PyArray_MultiIterNew4(a, b, c, d):
+ *     return PyArray_MultiIterNew(4, <void*>a, <void*>b, <void*>c, <void*> d)             # <<<<<<<<<<<<<<
+ * 
+ * cdef inline object PyArray_MultiIterNew5(a, b, c, d, e):
+ */
+  __Pyx_XDECREF(__pyx_r);
+  __pyx_t_1 = PyArray_MultiIterNew(4, ((void *)__pyx_v_a), ((void *)__pyx_v_b), ((void *)__pyx_v_c), ((void *)__pyx_v_d)); if (unlikely(!__pyx_t_1)) __PYX_ERR(1, 744, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __pyx_r = __pyx_t_1;
+  __pyx_t_1 = 0;
+  goto __pyx_L0;
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":743
+ *     return PyArray_MultiIterNew(3, <void*>a, <void*>b, <void*> c)
+ * 
+ * cdef inline object PyArray_MultiIterNew4(a, b, c, d):             # <<<<<<<<<<<<<<
+ *     return PyArray_MultiIterNew(4, <void*>a, <void*>b, <void*>c, <void*> d)
+ * 
+ */
+
+  /* function exit code */
+  __pyx_L1_error:;
+  __Pyx_XDECREF(__pyx_t_1);
+  __Pyx_AddTraceback("numpy.PyArray_MultiIterNew4", __pyx_clineno, __pyx_lineno, __pyx_filename);
+  __pyx_r = 0;
+  __pyx_L0:;
+  __Pyx_XGIVEREF(__pyx_r);
+  __Pyx_RefNannyFinishContext();
+  return __pyx_r;
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":746
+ *     return PyArray_MultiIterNew(4, <void*>a, <void*>b, <void*>c, <void*> d)
+ * 
+ * cdef inline object PyArray_MultiIterNew5(a, b, c, d, e):             # <<<<<<<<<<<<<<
+ *     return PyArray_MultiIterNew(5, <void*>a, <void*>b, <void*>c, <void*> d, <void*> e)
+ * 
+ */
+
+static CYTHON_INLINE PyObject *__pyx_f_5numpy_PyArray_MultiIterNew5(PyObject *__pyx_v_a, PyObject *__pyx_v_b, PyObject *__pyx_v_c, PyObject *__pyx_v_d, PyObject *__pyx_v_e) {
+  PyObject *__pyx_r = NULL;
+  __Pyx_RefNannyDeclarations
+  PyObject *__pyx_t_1 = NULL;
+  int __pyx_lineno = 0;
+  const char *__pyx_filename = NULL;
+  int __pyx_clineno = 0;
+  __Pyx_RefNannySetupContext("PyArray_MultiIterNew5", 0);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":747
+ * 
+ * cdef inline object PyArray_MultiIterNew5(a, b, c, d, e):
+ *     return PyArray_MultiIterNew(5, <void*>a, <void*>b, <void*>c, <void*> d, <void*> e)             # <<<<<<<<<<<<<<
+ * 
+ * cdef inline tuple PyDataType_SHAPE(dtype d):
+ */
+  __Pyx_XDECREF(__pyx_r);
+  __pyx_t_1 = PyArray_MultiIterNew(5, ((void *)__pyx_v_a), ((void *)__pyx_v_b), ((void *)__pyx_v_c), ((void *)__pyx_v_d), ((void *)__pyx_v_e)); if (unlikely(!__pyx_t_1)) __PYX_ERR(1, 747, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __pyx_r = __pyx_t_1;
+  __pyx_t_1 = 0;
+  goto __pyx_L0;
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":746
+ *     return PyArray_MultiIterNew(4, <void*>a, <void*>b, <void*>c, <void*> d)
+ * 
+ * cdef inline object PyArray_MultiIterNew5(a, b, c, d, e):             # <<<<<<<<<<<<<<
+ *     return PyArray_MultiIterNew(5, <void*>a, <void*>b, <void*>c, <void*> d, <void*> e)
+ * 
+ */
+
+  /* function exit code */
+  __pyx_L1_error:;
+  __Pyx_XDECREF(__pyx_t_1);
+  __Pyx_AddTraceback("numpy.PyArray_MultiIterNew5", __pyx_clineno, __pyx_lineno, __pyx_filename);
+  __pyx_r = 0;
+  __pyx_L0:;
+  __Pyx_XGIVEREF(__pyx_r);
+  __Pyx_RefNannyFinishContext();
+  return __pyx_r;
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":749
+ *     return PyArray_MultiIterNew(5, <void*>a, <void*>b, <void*>c, <void*> d, <void*> e)
+ * 
+ * cdef inline tuple PyDataType_SHAPE(dtype d):             # <<<<<<<<<<<<<<
+ *     if PyDataType_HASSUBARRAY(d):
+ *         return <tuple>d.subarray.shape
+ */
+
+static CYTHON_INLINE PyObject *__pyx_f_5numpy_PyDataType_SHAPE(PyArray_Descr *__pyx_v_d) {
+  PyObject *__pyx_r = NULL;
+  __Pyx_RefNannyDeclarations
+  int __pyx_t_1;
+  __Pyx_RefNannySetupContext("PyDataType_SHAPE", 0);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":750
+ * 
+ * cdef inline tuple PyDataType_SHAPE(dtype d):
+ *     if PyDataType_HASSUBARRAY(d):             # <<<<<<<<<<<<<<
+ *         return <tuple>d.subarray.shape
+ *     else:
+ */
+  __pyx_t_1 = (PyDataType_HASSUBARRAY(__pyx_v_d) != 0);
+  if (__pyx_t_1) {
+
+    /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":751
+ * cdef inline tuple PyDataType_SHAPE(dtype d):
+ *     if PyDataType_HASSUBARRAY(d):
+ *         return <tuple>d.subarray.shape             # <<<<<<<<<<<<<<
+ *     else:
+ *         return ()
+ */
+    __Pyx_XDECREF(__pyx_r);
+    __Pyx_INCREF(((PyObject*)__pyx_v_d->subarray->shape));
+    __pyx_r = ((PyObject*)__pyx_v_d->subarray->shape);
+    goto __pyx_L0;
+
+    /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":750
+ * 
+ * cdef inline tuple PyDataType_SHAPE(dtype d):
+ *     if PyDataType_HASSUBARRAY(d):             # <<<<<<<<<<<<<<
+ *         return <tuple>d.subarray.shape
+ *     else:
+ */
+  }
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":753
+ *         return <tuple>d.subarray.shape
+ *     else:
+ *         return ()             # <<<<<<<<<<<<<<
+ * 
+ * 
+ */
+  /*else*/ {
+    __Pyx_XDECREF(__pyx_r);
+    __Pyx_INCREF(__pyx_empty_tuple);
+    __pyx_r = __pyx_empty_tuple;
+    goto __pyx_L0;
+  }
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":749
+ *     return PyArray_MultiIterNew(5, <void*>a, <void*>b, <void*>c, <void*> d, <void*> e)
+ * 
+ * cdef inline tuple PyDataType_SHAPE(dtype d):             # <<<<<<<<<<<<<<
+ *     if PyDataType_HASSUBARRAY(d):
+ *         return <tuple>d.subarray.shape
+ */
+
+  /* function exit code */
+  __pyx_L0:;
+  __Pyx_XGIVEREF(__pyx_r);
+  __Pyx_RefNannyFinishContext();
+  return __pyx_r;
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":928
+ *     int _import_umath() except -1
+ * 
+ * cdef inline void set_array_base(ndarray arr, object base):             # <<<<<<<<<<<<<<
+ *     Py_INCREF(base) # important to do this before stealing the reference below!
+ *     PyArray_SetBaseObject(arr, base)
+ */
+
+static CYTHON_INLINE void __pyx_f_5numpy_set_array_base(PyArrayObject *__pyx_v_arr, PyObject *__pyx_v_base) {
+  __Pyx_RefNannyDeclarations
+  __Pyx_RefNannySetupContext("set_array_base", 0);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":929
+ * 
+ * cdef inline void set_array_base(ndarray arr, object base):
+ *     Py_INCREF(base) # important to do this before stealing the reference below!             # <<<<<<<<<<<<<<
+ *     PyArray_SetBaseObject(arr, base)
+ * 
+ */
+  Py_INCREF(__pyx_v_base);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":930
+ * cdef inline void set_array_base(ndarray arr, object base):
+ *     Py_INCREF(base) # important to do this before stealing the reference below!
+ *     PyArray_SetBaseObject(arr, base)             # <<<<<<<<<<<<<<
+ * 
+ * cdef inline object get_array_base(ndarray arr):
+ */
+  (void)(PyArray_SetBaseObject(__pyx_v_arr, __pyx_v_base));
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":928
+ *     int _import_umath() except -1
+ * 
+ * cdef inline void set_array_base(ndarray arr, object base):             # <<<<<<<<<<<<<<
+ *     Py_INCREF(base) # important to do this before stealing the reference below!
+ *     PyArray_SetBaseObject(arr, base)
+ */
+
+  /* function exit code */
+  __Pyx_RefNannyFinishContext();
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":932
+ *     PyArray_SetBaseObject(arr, base)
+ * 
+ * cdef inline object get_array_base(ndarray arr):             # <<<<<<<<<<<<<<
+ *     base = PyArray_BASE(arr)
+ *     if base is NULL:
+ */
+
+static CYTHON_INLINE PyObject *__pyx_f_5numpy_get_array_base(PyArrayObject *__pyx_v_arr) {
+  PyObject *__pyx_v_base;
+  PyObject *__pyx_r = NULL;
+  __Pyx_RefNannyDeclarations
+  int __pyx_t_1;
+  __Pyx_RefNannySetupContext("get_array_base", 0);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":933
+ * 
+ * cdef inline object get_array_base(ndarray arr):
+ *     base = PyArray_BASE(arr)             # <<<<<<<<<<<<<<
+ *     if base is NULL:
+ *         return None
+ */
+  __pyx_v_base = PyArray_BASE(__pyx_v_arr);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":934
+ * cdef inline object get_array_base(ndarray arr):
+ *     base = PyArray_BASE(arr)
+ *     if base is NULL:             # <<<<<<<<<<<<<<
+ *         return None
+ *     return <object>base
+ */
+  __pyx_t_1 = ((__pyx_v_base == NULL) != 0);
+  if (__pyx_t_1) {
+
+    /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":935
+ *     base = PyArray_BASE(arr)
+ *     if base is NULL:
+ *         return None             # <<<<<<<<<<<<<<
+ *     return <object>base
+ * 
+ */
+    __Pyx_XDECREF(__pyx_r);
+    __pyx_r = Py_None; __Pyx_INCREF(Py_None);
+    goto __pyx_L0;
+
+    /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":934
+ * cdef inline object get_array_base(ndarray arr):
+ *     base = PyArray_BASE(arr)
+ *     if base is NULL:             # <<<<<<<<<<<<<<
+ *         return None
+ *     return <object>base
+ */
+  }
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":936
+ *     if base is NULL:
+ *         return None
+ *     return <object>base             # <<<<<<<<<<<<<<
+ * 
+ * # Versions of the import_* functions which are more suitable for
+ */
+  __Pyx_XDECREF(__pyx_r);
+  __Pyx_INCREF(((PyObject *)__pyx_v_base));
+  __pyx_r = ((PyObject *)__pyx_v_base);
+  goto __pyx_L0;
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":932
+ *     PyArray_SetBaseObject(arr, base)
+ * 
+ * cdef inline object get_array_base(ndarray arr):             # <<<<<<<<<<<<<<
+ *     base = PyArray_BASE(arr)
+ *     if base is NULL:
+ */
+
+  /* function exit code */
+  __pyx_L0:;
+  __Pyx_XGIVEREF(__pyx_r);
+  __Pyx_RefNannyFinishContext();
+  return __pyx_r;
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":940
+ * # Versions of the import_* functions which are more suitable for
+ * # Cython code.
+ * cdef inline int import_array() except -1:             # <<<<<<<<<<<<<<
+ *     try:
+ *         __pyx_import_array()
+ */
+
+static CYTHON_INLINE int __pyx_f_5numpy_import_array(void) {
+  int __pyx_r;
+  __Pyx_RefNannyDeclarations
+  PyObject *__pyx_t_1 = NULL;
+  PyObject *__pyx_t_2 = NULL;
+  PyObject *__pyx_t_3 = NULL;
+  int __pyx_t_4;
+  PyObject *__pyx_t_5 = NULL;
+  PyObject *__pyx_t_6 = NULL;
+  PyObject *__pyx_t_7 = NULL;
+  PyObject *__pyx_t_8 = NULL;
+  int __pyx_lineno = 0;
+  const char *__pyx_filename = NULL;
+  int __pyx_clineno = 0;
+  __Pyx_RefNannySetupContext("import_array", 0);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":941
+ * # Cython code.
+ * cdef inline int import_array() except -1:
+ *     try:             # <<<<<<<<<<<<<<
+ *         __pyx_import_array()
+ *     except Exception:
+ */
+  {
+    __Pyx_PyThreadState_declare
+    __Pyx_PyThreadState_assign
+    __Pyx_ExceptionSave(&__pyx_t_1, &__pyx_t_2, &__pyx_t_3);
+    __Pyx_XGOTREF(__pyx_t_1);
+    __Pyx_XGOTREF(__pyx_t_2);
+    __Pyx_XGOTREF(__pyx_t_3);
+    /*try:*/ {
+
+      /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":942
+ * cdef inline int import_array() except -1:
+ *     try:
+ *         __pyx_import_array()             # <<<<<<<<<<<<<<
+ *     except Exception:
+ *         raise ImportError("numpy.core.multiarray failed to import")
+ */
+      __pyx_t_4 = _import_array(); if (unlikely(__pyx_t_4 == ((int)-1))) __PYX_ERR(1, 942, __pyx_L3_error)
+
+      /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":941
+ * # Cython code.
+ * cdef inline int import_array() except -1:
+ *     try:             # <<<<<<<<<<<<<<
+ *         __pyx_import_array()
+ *     except Exception:
+ */
+    }
+    __Pyx_XDECREF(__pyx_t_1); __pyx_t_1 = 0;
+    __Pyx_XDECREF(__pyx_t_2); __pyx_t_2 = 0;
+    __Pyx_XDECREF(__pyx_t_3); __pyx_t_3 = 0;
+    goto __pyx_L8_try_end;
+    __pyx_L3_error:;
+
+    /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":943
+ *     try:
+ *         __pyx_import_array()
+ *     except Exception:             # <<<<<<<<<<<<<<
+ *         raise ImportError("numpy.core.multiarray failed to import")
+ * 
+ */
+    __pyx_t_4 = __Pyx_PyErr_ExceptionMatches(((PyObject *)(&((PyTypeObject*)PyExc_Exception)[0])));
+    if (__pyx_t_4) {
+      __Pyx_AddTraceback("numpy.import_array", __pyx_clineno, __pyx_lineno, __pyx_filename);
+      if (__Pyx_GetException(&__pyx_t_5, &__pyx_t_6, &__pyx_t_7) < 0) __PYX_ERR(1, 943, __pyx_L5_except_error)
+      __Pyx_GOTREF(__pyx_t_5);
+      __Pyx_GOTREF(__pyx_t_6);
+      __Pyx_GOTREF(__pyx_t_7);
+
+      /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":944
+ *         __pyx_import_array()
+ *     except Exception:
+ *         raise ImportError("numpy.core.multiarray failed to import")             # <<<<<<<<<<<<<<
+ * 
+ * cdef inline int import_umath() except -1:
+ */
+      __pyx_t_8 = __Pyx_PyObject_Call(__pyx_builtin_ImportError, __pyx_tuple__4, NULL); if (unlikely(!__pyx_t_8)) __PYX_ERR(1, 944, __pyx_L5_except_error)
+      __Pyx_GOTREF(__pyx_t_8);
+      __Pyx_Raise(__pyx_t_8, 0, 0, 0);
+      __Pyx_DECREF(__pyx_t_8); __pyx_t_8 = 0;
+      __PYX_ERR(1, 944, __pyx_L5_except_error)
+    }
+    goto __pyx_L5_except_error;
+    __pyx_L5_except_error:;
+
+    /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":941
+ * # Cython code.
+ * cdef inline int import_array() except -1:
+ *     try:             # <<<<<<<<<<<<<<
+ *         __pyx_import_array()
+ *     except Exception:
+ */
+    __Pyx_XGIVEREF(__pyx_t_1);
+    __Pyx_XGIVEREF(__pyx_t_2);
+    __Pyx_XGIVEREF(__pyx_t_3);
+    __Pyx_ExceptionReset(__pyx_t_1, __pyx_t_2, __pyx_t_3);
+    goto __pyx_L1_error;
+    __pyx_L8_try_end:;
+  }
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":940
+ * # Versions of the import_* functions which are more suitable for
+ * # Cython code.
+ * cdef inline int import_array() except -1:             # <<<<<<<<<<<<<<
+ *     try:
+ *         __pyx_import_array()
+ */
+
+  /* function exit code */
+  __pyx_r = 0;
+  goto __pyx_L0;
+  __pyx_L1_error:;
+  __Pyx_XDECREF(__pyx_t_5);
+  __Pyx_XDECREF(__pyx_t_6);
+  __Pyx_XDECREF(__pyx_t_7);
+  __Pyx_XDECREF(__pyx_t_8);
+  __Pyx_AddTraceback("numpy.import_array", __pyx_clineno, __pyx_lineno, __pyx_filename);
+  __pyx_r = -1;
+  __pyx_L0:;
+  __Pyx_RefNannyFinishContext();
+  return __pyx_r;
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":946
+ *         raise ImportError("numpy.core.multiarray failed to import")
+ * 
+ * cdef inline int import_umath() except -1:             # <<<<<<<<<<<<<<
+ *     try:
+ *         _import_umath()
+ */
+
+static CYTHON_INLINE int __pyx_f_5numpy_import_umath(void) {
+  int __pyx_r;
+  __Pyx_RefNannyDeclarations
+  PyObject *__pyx_t_1 = NULL;
+  PyObject *__pyx_t_2 = NULL;
+  PyObject *__pyx_t_3 = NULL;
+  int __pyx_t_4;
+  PyObject *__pyx_t_5 = NULL;
+  PyObject *__pyx_t_6 = NULL;
+  PyObject *__pyx_t_7 = NULL;
+  PyObject *__pyx_t_8 = NULL;
+  int __pyx_lineno = 0;
+  const char *__pyx_filename = NULL;
+  int __pyx_clineno = 0;
+  __Pyx_RefNannySetupContext("import_umath", 0);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":947
+ * 
+ * cdef inline int import_umath() except -1:
+ *     try:             # <<<<<<<<<<<<<<
+ *         _import_umath()
+ *     except Exception:
+ */
+  {
+    __Pyx_PyThreadState_declare
+    __Pyx_PyThreadState_assign
+    __Pyx_ExceptionSave(&__pyx_t_1, &__pyx_t_2, &__pyx_t_3);
+    __Pyx_XGOTREF(__pyx_t_1);
+    __Pyx_XGOTREF(__pyx_t_2);
+    __Pyx_XGOTREF(__pyx_t_3);
+    /*try:*/ {
+
+      /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":948
+ * cdef inline int import_umath() except -1:
+ *     try:
+ *         _import_umath()             # <<<<<<<<<<<<<<
+ *     except Exception:
+ *         raise ImportError("numpy.core.umath failed to import")
+ */
+      __pyx_t_4 = _import_umath(); if (unlikely(__pyx_t_4 == ((int)-1))) __PYX_ERR(1, 948, __pyx_L3_error)
+
+      /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":947
+ * 
+ * cdef inline int import_umath() except -1:
+ *     try:             # <<<<<<<<<<<<<<
+ *         _import_umath()
+ *     except Exception:
+ */
+    }
+    __Pyx_XDECREF(__pyx_t_1); __pyx_t_1 = 0;
+    __Pyx_XDECREF(__pyx_t_2); __pyx_t_2 = 0;
+    __Pyx_XDECREF(__pyx_t_3); __pyx_t_3 = 0;
+    goto __pyx_L8_try_end;
+    __pyx_L3_error:;
+
+    /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":949
+ *     try:
+ *         _import_umath()
+ *     except Exception:             # <<<<<<<<<<<<<<
+ *         raise ImportError("numpy.core.umath failed to import")
+ * 
+ */
+    __pyx_t_4 = __Pyx_PyErr_ExceptionMatches(((PyObject *)(&((PyTypeObject*)PyExc_Exception)[0])));
+    if (__pyx_t_4) {
+      __Pyx_AddTraceback("numpy.import_umath", __pyx_clineno, __pyx_lineno, __pyx_filename);
+      if (__Pyx_GetException(&__pyx_t_5, &__pyx_t_6, &__pyx_t_7) < 0) __PYX_ERR(1, 949, __pyx_L5_except_error)
+      __Pyx_GOTREF(__pyx_t_5);
+      __Pyx_GOTREF(__pyx_t_6);
+      __Pyx_GOTREF(__pyx_t_7);
+
+      /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":950
+ *         _import_umath()
+ *     except Exception:
+ *         raise ImportError("numpy.core.umath failed to import")             # <<<<<<<<<<<<<<
+ * 
+ * cdef inline int import_ufunc() except -1:
+ */
+      __pyx_t_8 = __Pyx_PyObject_Call(__pyx_builtin_ImportError, __pyx_tuple__5, NULL); if (unlikely(!__pyx_t_8)) __PYX_ERR(1, 950, __pyx_L5_except_error)
+      __Pyx_GOTREF(__pyx_t_8);
+      __Pyx_Raise(__pyx_t_8, 0, 0, 0);
+      __Pyx_DECREF(__pyx_t_8); __pyx_t_8 = 0;
+      __PYX_ERR(1, 950, __pyx_L5_except_error)
+    }
+    goto __pyx_L5_except_error;
+    __pyx_L5_except_error:;
+
+    /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":947
+ * 
+ * cdef inline int import_umath() except -1:
+ *     try:             # <<<<<<<<<<<<<<
+ *         _import_umath()
+ *     except Exception:
+ */
+    __Pyx_XGIVEREF(__pyx_t_1);
+    __Pyx_XGIVEREF(__pyx_t_2);
+    __Pyx_XGIVEREF(__pyx_t_3);
+    __Pyx_ExceptionReset(__pyx_t_1, __pyx_t_2, __pyx_t_3);
+    goto __pyx_L1_error;
+    __pyx_L8_try_end:;
+  }
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":946
+ *         raise ImportError("numpy.core.multiarray failed to import")
+ * 
+ * cdef inline int import_umath() except -1:             # <<<<<<<<<<<<<<
+ *     try:
+ *         _import_umath()
+ */
+
+  /* function exit code */
+  __pyx_r = 0;
+  goto __pyx_L0;
+  __pyx_L1_error:;
+  __Pyx_XDECREF(__pyx_t_5);
+  __Pyx_XDECREF(__pyx_t_6);
+  __Pyx_XDECREF(__pyx_t_7);
+  __Pyx_XDECREF(__pyx_t_8);
+  __Pyx_AddTraceback("numpy.import_umath", __pyx_clineno, __pyx_lineno, __pyx_filename);
+  __pyx_r = -1;
+  __pyx_L0:;
+  __Pyx_RefNannyFinishContext();
+  return __pyx_r;
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":952
+ *         raise ImportError("numpy.core.umath failed to import")
+ * 
+ * cdef inline int import_ufunc() except -1:             # <<<<<<<<<<<<<<
+ *     try:
+ *         _import_umath()
+ */
+
+static CYTHON_INLINE int __pyx_f_5numpy_import_ufunc(void) {
+  int __pyx_r;
+  __Pyx_RefNannyDeclarations
+  PyObject *__pyx_t_1 = NULL;
+  PyObject *__pyx_t_2 = NULL;
+  PyObject *__pyx_t_3 = NULL;
+  int __pyx_t_4;
+  PyObject *__pyx_t_5 = NULL;
+  PyObject *__pyx_t_6 = NULL;
+  PyObject *__pyx_t_7 = NULL;
+  PyObject *__pyx_t_8 = NULL;
+  int __pyx_lineno = 0;
+  const char *__pyx_filename = NULL;
+  int __pyx_clineno = 0;
+  __Pyx_RefNannySetupContext("import_ufunc", 0);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":953
+ * 
+ * cdef inline int import_ufunc() except -1:
+ *     try:             # <<<<<<<<<<<<<<
+ *         _import_umath()
+ *     except Exception:
+ */
+  {
+    __Pyx_PyThreadState_declare
+    __Pyx_PyThreadState_assign
+    __Pyx_ExceptionSave(&__pyx_t_1, &__pyx_t_2, &__pyx_t_3);
+    __Pyx_XGOTREF(__pyx_t_1);
+    __Pyx_XGOTREF(__pyx_t_2);
+    __Pyx_XGOTREF(__pyx_t_3);
+    /*try:*/ {
+
+      /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":954
+ * cdef inline int import_ufunc() except -1:
+ *     try:
+ *         _import_umath()             # <<<<<<<<<<<<<<
+ *     except Exception:
+ *         raise ImportError("numpy.core.umath failed to import")
+ */
+      __pyx_t_4 = _import_umath(); if (unlikely(__pyx_t_4 == ((int)-1))) __PYX_ERR(1, 954, __pyx_L3_error)
+
+      /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":953
+ * 
+ * cdef inline int import_ufunc() except -1:
+ *     try:             # <<<<<<<<<<<<<<
+ *         _import_umath()
+ *     except Exception:
+ */
+    }
+    __Pyx_XDECREF(__pyx_t_1); __pyx_t_1 = 0;
+    __Pyx_XDECREF(__pyx_t_2); __pyx_t_2 = 0;
+    __Pyx_XDECREF(__pyx_t_3); __pyx_t_3 = 0;
+    goto __pyx_L8_try_end;
+    __pyx_L3_error:;
+
+    /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":955
+ *     try:
+ *         _import_umath()
+ *     except Exception:             # <<<<<<<<<<<<<<
+ *         raise ImportError("numpy.core.umath failed to import")
+ * 
+ */
+    __pyx_t_4 = __Pyx_PyErr_ExceptionMatches(((PyObject *)(&((PyTypeObject*)PyExc_Exception)[0])));
+    if (__pyx_t_4) {
+      __Pyx_AddTraceback("numpy.import_ufunc", __pyx_clineno, __pyx_lineno, __pyx_filename);
+      if (__Pyx_GetException(&__pyx_t_5, &__pyx_t_6, &__pyx_t_7) < 0) __PYX_ERR(1, 955, __pyx_L5_except_error)
+      __Pyx_GOTREF(__pyx_t_5);
+      __Pyx_GOTREF(__pyx_t_6);
+      __Pyx_GOTREF(__pyx_t_7);
+
+      /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":956
+ *         _import_umath()
+ *     except Exception:
+ *         raise ImportError("numpy.core.umath failed to import")             # <<<<<<<<<<<<<<
+ * 
+ * cdef extern from *:
+ */
+      __pyx_t_8 = __Pyx_PyObject_Call(__pyx_builtin_ImportError, __pyx_tuple__5, NULL); if (unlikely(!__pyx_t_8)) __PYX_ERR(1, 956, __pyx_L5_except_error)
+      __Pyx_GOTREF(__pyx_t_8);
+      __Pyx_Raise(__pyx_t_8, 0, 0, 0);
+      __Pyx_DECREF(__pyx_t_8); __pyx_t_8 = 0;
+      __PYX_ERR(1, 956, __pyx_L5_except_error)
+    }
+    goto __pyx_L5_except_error;
+    __pyx_L5_except_error:;
+
+    /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":953
+ * 
+ * cdef inline int import_ufunc() except -1:
+ *     try:             # <<<<<<<<<<<<<<
+ *         _import_umath()
+ *     except Exception:
+ */
+    __Pyx_XGIVEREF(__pyx_t_1);
+    __Pyx_XGIVEREF(__pyx_t_2);
+    __Pyx_XGIVEREF(__pyx_t_3);
+    __Pyx_ExceptionReset(__pyx_t_1, __pyx_t_2, __pyx_t_3);
+    goto __pyx_L1_error;
+    __pyx_L8_try_end:;
+  }
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":952
+ *         raise ImportError("numpy.core.umath failed to import")
+ * 
+ * cdef inline int import_ufunc() except -1:             # <<<<<<<<<<<<<<
+ *     try:
+ *         _import_umath()
+ */
+
+  /* function exit code */
+  __pyx_r = 0;
+  goto __pyx_L0;
+  __pyx_L1_error:;
+  __Pyx_XDECREF(__pyx_t_5);
+  __Pyx_XDECREF(__pyx_t_6);
+  __Pyx_XDECREF(__pyx_t_7);
+  __Pyx_XDECREF(__pyx_t_8);
+  __Pyx_AddTraceback("numpy.import_ufunc", __pyx_clineno, __pyx_lineno, __pyx_filename);
+  __pyx_r = -1;
+  __pyx_L0:;
+  __Pyx_RefNannyFinishContext();
+  return __pyx_r;
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":966
+ * 
+ * 
+ * cdef inline bint is_timedelta64_object(object obj):             # <<<<<<<<<<<<<<
+ *     """
+ *     Cython equivalent of `isinstance(obj, np.timedelta64)`
+ */
+
+static CYTHON_INLINE int __pyx_f_5numpy_is_timedelta64_object(PyObject *__pyx_v_obj) {
+  int __pyx_r;
+  __Pyx_RefNannyDeclarations
+  __Pyx_RefNannySetupContext("is_timedelta64_object", 0);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":978
+ *     bool
+ *     """
+ *     return PyObject_TypeCheck(obj, &PyTimedeltaArrType_Type)             # <<<<<<<<<<<<<<
+ * 
+ * 
+ */
+  __pyx_r = PyObject_TypeCheck(__pyx_v_obj, (&PyTimedeltaArrType_Type));
+  goto __pyx_L0;
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":966
+ * 
+ * 
+ * cdef inline bint is_timedelta64_object(object obj):             # <<<<<<<<<<<<<<
+ *     """
+ *     Cython equivalent of `isinstance(obj, np.timedelta64)`
+ */
+
+  /* function exit code */
+  __pyx_L0:;
+  __Pyx_RefNannyFinishContext();
+  return __pyx_r;
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":981
+ * 
+ * 
+ * cdef inline bint is_datetime64_object(object obj):             # <<<<<<<<<<<<<<
+ *     """
+ *     Cython equivalent of `isinstance(obj, np.datetime64)`
+ */
+
+static CYTHON_INLINE int __pyx_f_5numpy_is_datetime64_object(PyObject *__pyx_v_obj) {
+  int __pyx_r;
+  __Pyx_RefNannyDeclarations
+  __Pyx_RefNannySetupContext("is_datetime64_object", 0);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":993
+ *     bool
+ *     """
+ *     return PyObject_TypeCheck(obj, &PyDatetimeArrType_Type)             # <<<<<<<<<<<<<<
+ * 
+ * 
+ */
+  __pyx_r = PyObject_TypeCheck(__pyx_v_obj, (&PyDatetimeArrType_Type));
+  goto __pyx_L0;
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":981
+ * 
+ * 
+ * cdef inline bint is_datetime64_object(object obj):             # <<<<<<<<<<<<<<
+ *     """
+ *     Cython equivalent of `isinstance(obj, np.datetime64)`
+ */
+
+  /* function exit code */
+  __pyx_L0:;
+  __Pyx_RefNannyFinishContext();
+  return __pyx_r;
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":996
+ * 
+ * 
+ * cdef inline npy_datetime get_datetime64_value(object obj) nogil:             # <<<<<<<<<<<<<<
+ *     """
+ *     returns the int64 value underlying scalar numpy datetime64 object
+ */
+
+static CYTHON_INLINE npy_datetime __pyx_f_5numpy_get_datetime64_value(PyObject *__pyx_v_obj) {
+  npy_datetime __pyx_r;
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":1003
+ *     also needed.  That can be found using `get_datetime64_unit`.
+ *     """
+ *     return (<PyDatetimeScalarObject*>obj).obval             # <<<<<<<<<<<<<<
+ * 
+ * 
+ */
+  __pyx_r = ((PyDatetimeScalarObject *)__pyx_v_obj)->obval;
+  goto __pyx_L0;
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":996
+ * 
+ * 
+ * cdef inline npy_datetime get_datetime64_value(object obj) nogil:             # <<<<<<<<<<<<<<
+ *     """
+ *     returns the int64 value underlying scalar numpy datetime64 object
+ */
+
+  /* function exit code */
+  __pyx_L0:;
+  return __pyx_r;
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":1006
+ * 
+ * 
+ * cdef inline npy_timedelta get_timedelta64_value(object obj) nogil:             # <<<<<<<<<<<<<<
+ *     """
+ *     returns the int64 value underlying scalar numpy timedelta64 object
+ */
+
+static CYTHON_INLINE npy_timedelta __pyx_f_5numpy_get_timedelta64_value(PyObject *__pyx_v_obj) {
+  npy_timedelta __pyx_r;
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":1010
+ *     returns the int64 value underlying scalar numpy timedelta64 object
+ *     """
+ *     return (<PyTimedeltaScalarObject*>obj).obval             # <<<<<<<<<<<<<<
+ * 
+ * 
+ */
+  __pyx_r = ((PyTimedeltaScalarObject *)__pyx_v_obj)->obval;
+  goto __pyx_L0;
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":1006
+ * 
+ * 
+ * cdef inline npy_timedelta get_timedelta64_value(object obj) nogil:             # <<<<<<<<<<<<<<
+ *     """
+ *     returns the int64 value underlying scalar numpy timedelta64 object
+ */
+
+  /* function exit code */
+  __pyx_L0:;
+  return __pyx_r;
+}
+
+/* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":1013
+ * 
+ * 
+ * cdef inline NPY_DATETIMEUNIT get_datetime64_unit(object obj) nogil:             # <<<<<<<<<<<<<<
+ *     """
+ *     returns the unit part of the dtype for a numpy datetime64 object.
+ */
+
+static CYTHON_INLINE NPY_DATETIMEUNIT __pyx_f_5numpy_get_datetime64_unit(PyObject *__pyx_v_obj) {
+  NPY_DATETIMEUNIT __pyx_r;
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":1017
+ *     returns the unit part of the dtype for a numpy datetime64 object.
+ *     """
+ *     return <NPY_DATETIMEUNIT>(<PyDatetimeScalarObject*>obj).obmeta.base             # <<<<<<<<<<<<<<
+ */
+  __pyx_r = ((NPY_DATETIMEUNIT)((PyDatetimeScalarObject *)__pyx_v_obj)->obmeta.base);
+  goto __pyx_L0;
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":1013
+ * 
+ * 
+ * cdef inline NPY_DATETIMEUNIT get_datetime64_unit(object obj) nogil:             # <<<<<<<<<<<<<<
+ *     """
+ *     returns the unit part of the dtype for a numpy datetime64 object.
+ */
+
+  /* function exit code */
+  __pyx_L0:;
+  return __pyx_r;
+}
+
+static PyMethodDef __pyx_methods[] = {
+  {0, 0, 0, 0}
+};
+
+#if PY_MAJOR_VERSION >= 3
+#if CYTHON_PEP489_MULTI_PHASE_INIT
+static PyObject* __pyx_pymod_create(PyObject *spec, PyModuleDef *def); /*proto*/
+static int __pyx_pymod_exec_c_redfield(PyObject* module); /*proto*/
+static PyModuleDef_Slot __pyx_moduledef_slots[] = {
+  {Py_mod_create, (void*)__pyx_pymod_create},
+  {Py_mod_exec, (void*)__pyx_pymod_exec_c_redfield},
+  {0, NULL}
+};
+#endif
+
+static struct PyModuleDef __pyx_moduledef = {
+    PyModuleDef_HEAD_INIT,
+    "c_redfield",
+    __pyx_k_Module_containing_cython_functio, /* m_doc */
+  #if CYTHON_PEP489_MULTI_PHASE_INIT
+    0, /* m_size */
+  #else
+    -1, /* m_size */
+  #endif
+    __pyx_methods /* m_methods */,
+  #if CYTHON_PEP489_MULTI_PHASE_INIT
+    __pyx_moduledef_slots, /* m_slots */
+  #else
+    NULL, /* m_reload */
+  #endif
+    NULL, /* m_traverse */
+    NULL, /* m_clear */
+    NULL /* m_free */
+};
+#endif
+#ifndef CYTHON_SMALL_CODE
+#if defined(__clang__)
+    #define CYTHON_SMALL_CODE
+#elif defined(__GNUC__) && (__GNUC__ > 4 || (__GNUC__ == 4 && __GNUC_MINOR__ >= 3))
+    #define CYTHON_SMALL_CODE __attribute__((cold))
+#else
+    #define CYTHON_SMALL_CODE
+#endif
+#endif
+
+static __Pyx_StringTabEntry __pyx_string_tab[] = {
+  {&__pyx_n_s_ApproachElPh, __pyx_k_ApproachElPh, sizeof(__pyx_k_ApproachElPh), 0, 0, 1, 1},
+  {&__pyx_n_s_ApproachRedfield, __pyx_k_ApproachRedfield, sizeof(__pyx_k_ApproachRedfield), 0, 0, 1, 1},
+  {&__pyx_n_s_E, __pyx_k_E, sizeof(__pyx_k_E), 0, 0, 1, 1},
+  {&__pyx_n_s_Ea, __pyx_k_Ea, sizeof(__pyx_k_Ea), 0, 0, 1, 1},
+  {&__pyx_n_s_ImportError, __pyx_k_ImportError, sizeof(__pyx_k_ImportError), 0, 0, 1, 1},
+  {&__pyx_n_s_Redfield, __pyx_k_Redfield, sizeof(__pyx_k_Redfield), 0, 0, 1, 1},
+  {&__pyx_n_s_Vbbp, __pyx_k_Vbbp, sizeof(__pyx_k_Vbbp), 0, 0, 1, 1},
+  {&__pyx_n_s_a, __pyx_k_a, sizeof(__pyx_k_a), 0, 0, 1, 1},
+  {&__pyx_n_s_aap, __pyx_k_aap, sizeof(__pyx_k_aap), 0, 0, 1, 1},
+  {&__pyx_n_s_aap_sgn, __pyx_k_aap_sgn, sizeof(__pyx_k_aap_sgn), 0, 0, 1, 1},
+  {&__pyx_n_s_aapi, __pyx_k_aapi, sizeof(__pyx_k_aapi), 0, 0, 1, 1},
+  {&__pyx_n_s_ap, __pyx_k_ap, sizeof(__pyx_k_ap), 0, 0, 1, 1},
+  {&__pyx_n_s_aprclass, __pyx_k_aprclass, sizeof(__pyx_k_aprclass), 0, 0, 1, 1},
+  {&__pyx_n_s_b, __pyx_k_b, sizeof(__pyx_k_b), 0, 0, 1, 1},
+  {&__pyx_n_s_ba, __pyx_k_ba, sizeof(__pyx_k_ba), 0, 0, 1, 1},
+  {&__pyx_n_s_base_c_neumann1, __pyx_k_base_c_neumann1, sizeof(__pyx_k_base_c_neumann1), 0, 0, 1, 1},
+  {&__pyx_n_s_base_c_pauli, __pyx_k_base_c_pauli, sizeof(__pyx_k_base_c_pauli), 0, 0, 1, 1},
+  {&__pyx_n_s_base_c_redfield, __pyx_k_base_c_redfield, sizeof(__pyx_k_base_c_redfield), 0, 0, 1, 1},
+  {&__pyx_n_s_baths, __pyx_k_baths, sizeof(__pyx_k_baths), 0, 0, 1, 1},
+  {&__pyx_n_s_bb, __pyx_k_bb, sizeof(__pyx_k_bb), 0, 0, 1, 1},
+  {&__pyx_n_s_bbp, __pyx_k_bbp, sizeof(__pyx_k_bbp), 0, 0, 1, 1},
+  {&__pyx_n_s_bbp_bool, __pyx_k_bbp_bool, sizeof(__pyx_k_bbp_bool), 0, 0, 1, 1},
+  {&__pyx_n_s_bbpi, __pyx_k_bbpi, sizeof(__pyx_k_bbpi), 0, 0, 1, 1},
+  {&__pyx_n_s_bbpi_bool, __pyx_k_bbpi_bool, sizeof(__pyx_k_bbpi_bool), 0, 0, 1, 1},
+  {&__pyx_n_s_bbpp, __pyx_k_bbpp, sizeof(__pyx_k_bbpp), 0, 0, 1, 1},
+  {&__pyx_n_s_bbpp_sgn, __pyx_k_bbpp_sgn, sizeof(__pyx_k_bbpp_sgn), 0, 0, 1, 1},
+  {&__pyx_n_s_bbppi, __pyx_k_bbppi, sizeof(__pyx_k_bbppi), 0, 0, 1, 1},
+  {&__pyx_n_s_booldm0, __pyx_k_booldm0, sizeof(__pyx_k_booldm0), 0, 0, 1, 1},
+  {&__pyx_n_s_bp, __pyx_k_bp, sizeof(__pyx_k_bp), 0, 0, 1, 1},
+  {&__pyx_n_s_bpap, __pyx_k_bpap, sizeof(__pyx_k_bpap), 0, 0, 1, 1},
+  {&__pyx_n_s_bpp, __pyx_k_bpp, sizeof(__pyx_k_bpp), 0, 0, 1, 1},
+  {&__pyx_n_s_bppa, __pyx_k_bppa, sizeof(__pyx_k_bppa), 0, 0, 1, 1},
+  {&__pyx_n_s_bppbp, __pyx_k_bppbp, sizeof(__pyx_k_bppbp), 0, 0, 1, 1},
+  {&__pyx_n_s_bppbp_sgn, __pyx_k_bppbp_sgn, sizeof(__pyx_k_bppbp_sgn), 0, 0, 1, 1},
+  {&__pyx_n_s_bppbpi, __pyx_k_bppbpi, sizeof(__pyx_k_bppbpi), 0, 0, 1, 1},
+  {&__pyx_n_s_c, __pyx_k_c, sizeof(__pyx_k_c), 0, 0, 1, 1},
+  {&__pyx_n_s_c_neumann1, __pyx_k_c_neumann1, sizeof(__pyx_k_c_neumann1), 0, 0, 1, 1},
+  {&__pyx_n_s_cb, __pyx_k_cb, sizeof(__pyx_k_cb), 0, 0, 1, 1},
+  {&__pyx_n_s_cbpp, __pyx_k_cbpp, sizeof(__pyx_k_cbpp), 0, 0, 1, 1},
+  {&__pyx_n_s_ccp, __pyx_k_ccp, sizeof(__pyx_k_ccp), 0, 0, 1, 1},
+  {&__pyx_n_s_ccp_sgn, __pyx_k_ccp_sgn, sizeof(__pyx_k_ccp_sgn), 0, 0, 1, 1},
+  {&__pyx_n_s_ccpi, __pyx_k_ccpi, sizeof(__pyx_k_ccpi), 0, 0, 1, 1},
+  {&__pyx_n_s_charge, __pyx_k_charge, sizeof(__pyx_k_charge), 0, 0, 1, 1},
+  {&__pyx_n_s_cline_in_traceback, __pyx_k_cline_in_traceback, sizeof(__pyx_k_cline_in_traceback), 0, 0, 1, 1},
+  {&__pyx_n_s_combinations_with_replacement, __pyx_k_combinations_with_replacement, sizeof(__pyx_k_combinations_with_replacement), 0, 0, 1, 1},
+  {&__pyx_n_s_complexnp, __pyx_k_complexnp, sizeof(__pyx_k_complexnp), 0, 0, 1, 1},
+  {&__pyx_n_s_conjdm0, __pyx_k_conjdm0, sizeof(__pyx_k_conjdm0), 0, 0, 1, 1},
+  {&__pyx_n_s_cp, __pyx_k_cp, sizeof(__pyx_k_cp), 0, 0, 1, 1},
+  {&__pyx_n_s_cpbp, __pyx_k_cpbp, sizeof(__pyx_k_cpbp), 0, 0, 1, 1},
+  {&__pyx_n_s_dictdm, __pyx_k_dictdm, sizeof(__pyx_k_dictdm), 0, 0, 1, 1},
+  {&__pyx_n_s_doc, __pyx_k_doc, sizeof(__pyx_k_doc), 0, 0, 1, 1},
+  {&__pyx_n_s_doublenp, __pyx_k_doublenp, sizeof(__pyx_k_doublenp), 0, 0, 1, 1},
+  {&__pyx_n_s_dtype, __pyx_k_dtype, sizeof(__pyx_k_dtype), 0, 0, 1, 1},
+  {&__pyx_n_s_fct_aap, __pyx_k_fct_aap, sizeof(__pyx_k_fct_aap), 0, 0, 1, 1},
+  {&__pyx_n_s_fct_bbpp, __pyx_k_fct_bbpp, sizeof(__pyx_k_fct_bbpp), 0, 0, 1, 1},
+  {&__pyx_n_s_fct_bppbp, __pyx_k_fct_bppbp, sizeof(__pyx_k_fct_bppbp), 0, 0, 1, 1},
+  {&__pyx_n_s_fct_ccp, __pyx_k_fct_ccp, sizeof(__pyx_k_fct_ccp), 0, 0, 1, 1},
+  {&__pyx_n_s_gamma_abpp_abp, __pyx_k_gamma_abpp_abp, sizeof(__pyx_k_gamma_abpp_abp), 0, 0, 1, 1},
+  {&__pyx_n_s_gamma_ba_bpap, __pyx_k_gamma_ba_bpap, sizeof(__pyx_k_gamma_ba_bpap), 0, 0, 1, 1},
+  {&__pyx_n_s_gamma_ba_bppa, __pyx_k_gamma_ba_bppa, sizeof(__pyx_k_gamma_ba_bppa), 0, 0, 1, 1},
+  {&__pyx_n_s_gamma_bc_bpcp, __pyx_k_gamma_bc_bpcp, sizeof(__pyx_k_gamma_bc_bpcp), 0, 0, 1, 1},
+  {&__pyx_n_s_gamma_bc_bppc, __pyx_k_gamma_bc_bppc, sizeof(__pyx_k_gamma_bc_bppc), 0, 0, 1, 1},
+  {&__pyx_n_s_gamma_cbpp_cbp, __pyx_k_gamma_cbpp_cbp, sizeof(__pyx_k_gamma_cbpp_cbp), 0, 0, 1, 1},
+  {&__pyx_n_s_generate_current, __pyx_k_generate_current, sizeof(__pyx_k_generate_current), 0, 0, 1, 1},
+  {&__pyx_n_s_generate_current_redfield, __pyx_k_generate_current_redfield, sizeof(__pyx_k_generate_current_redfield), 0, 0, 1, 1},
+  {&__pyx_n_s_generate_fct, __pyx_k_generate_fct, sizeof(__pyx_k_generate_fct), 0, 0, 1, 1},
+  {&__pyx_n_s_generate_fct_elph, __pyx_k_generate_fct_elph, sizeof(__pyx_k_generate_fct_elph), 0, 0, 1, 1},
+  {&__pyx_n_s_generate_kern, __pyx_k_generate_kern, sizeof(__pyx_k_generate_kern), 0, 0, 1, 1},
+  {&__pyx_n_s_generate_kern_elph, __pyx_k_generate_kern_elph, sizeof(__pyx_k_generate_kern_elph), 0, 0, 1, 1},
+  {&__pyx_n_s_generate_kern_redfield, __pyx_k_generate_kern_redfield, sizeof(__pyx_k_generate_kern_redfield), 0, 0, 1, 1},
+  {&__pyx_n_s_generate_kern_redfield_elph, __pyx_k_generate_kern_redfield_elph, sizeof(__pyx_k_generate_kern_redfield_elph), 0, 0, 1, 1},
+  {&__pyx_n_s_generate_norm_vec, __pyx_k_generate_norm_vec, sizeof(__pyx_k_generate_norm_vec), 0, 0, 1, 1},
+  {&__pyx_n_s_generate_phi1fct, __pyx_k_generate_phi1fct, sizeof(__pyx_k_generate_phi1fct), 0, 0, 1, 1},
+  {&__pyx_n_s_generate_vec, __pyx_k_generate_vec, sizeof(__pyx_k_generate_vec), 0, 0, 1, 1},
+  {&__pyx_n_s_generate_vec_redfield, __pyx_k_generate_vec_redfield, sizeof(__pyx_k_generate_vec_redfield), 0, 0, 1, 1},
+  {&__pyx_n_s_generate_w1fct_elph, __pyx_k_generate_w1fct_elph, sizeof(__pyx_k_generate_w1fct_elph), 0, 0, 1, 1},
+  {&__pyx_n_s_import, __pyx_k_import, sizeof(__pyx_k_import), 0, 0, 1, 1},
+  {&__pyx_n_s_itertools, __pyx_k_itertools, sizeof(__pyx_k_itertools), 0, 0, 1, 1},
+  {&__pyx_n_s_kern, __pyx_k_kern, sizeof(__pyx_k_kern), 0, 0, 1, 1},
+  {&__pyx_n_s_kern_ext, __pyx_k_kern_ext, sizeof(__pyx_k_kern_ext), 0, 0, 1, 1},
+  {&__pyx_n_s_kerntype, __pyx_k_kerntype, sizeof(__pyx_k_kerntype), 0, 0, 1, 1},
+  {&__pyx_n_s_l, __pyx_k_l, sizeof(__pyx_k_l), 0, 0, 1, 1},
+  {&__pyx_n_s_lenlst, __pyx_k_lenlst, sizeof(__pyx_k_lenlst), 0, 0, 1, 1},
+  {&__pyx_n_s_main, __pyx_k_main, sizeof(__pyx_k_main), 0, 0, 1, 1},
+  {&__pyx_n_s_mapdm0, __pyx_k_mapdm0, sizeof(__pyx_k_mapdm0), 0, 0, 1, 1},
+  {&__pyx_n_s_mapdm0_2, __pyx_k_mapdm0_2, sizeof(__pyx_k_mapdm0_2), 0, 0, 1, 1},
+  {&__pyx_n_s_metaclass, __pyx_k_metaclass, sizeof(__pyx_k_metaclass), 0, 0, 1, 1},
+  {&__pyx_n_s_module, __pyx_k_module, sizeof(__pyx_k_module), 0, 0, 1, 1},
+  {&__pyx_n_s_mytypes, __pyx_k_mytypes, sizeof(__pyx_k_mytypes), 0, 0, 1, 1},
+  {&__pyx_n_s_name, __pyx_k_name, sizeof(__pyx_k_name), 0, 0, 1, 1},
+  {&__pyx_n_s_nbaths, __pyx_k_nbaths, sizeof(__pyx_k_nbaths), 0, 0, 1, 1},
+  {&__pyx_n_s_ncharge, __pyx_k_ncharge, sizeof(__pyx_k_ncharge), 0, 0, 1, 1},
+  {&__pyx_n_s_ndm0, __pyx_k_ndm0, sizeof(__pyx_k_ndm0), 0, 0, 1, 1},
+  {&__pyx_n_s_ndm0r, __pyx_k_ndm0r, sizeof(__pyx_k_ndm0r), 0, 0, 1, 1},
+  {&__pyx_n_s_np, __pyx_k_np, sizeof(__pyx_k_np), 0, 0, 1, 1},
+  {&__pyx_n_s_npauli, __pyx_k_npauli, sizeof(__pyx_k_npauli), 0, 0, 1, 1},
+  {&__pyx_n_s_numpy, __pyx_k_numpy, sizeof(__pyx_k_numpy), 0, 0, 1, 1},
+  {&__pyx_kp_s_numpy_core_multiarray_failed_to, __pyx_k_numpy_core_multiarray_failed_to, sizeof(__pyx_k_numpy_core_multiarray_failed_to), 0, 0, 1, 0},
+  {&__pyx_kp_s_numpy_core_umath_failed_to_impor, __pyx_k_numpy_core_umath_failed_to_impor, sizeof(__pyx_k_numpy_core_umath_failed_to_impor), 0, 0, 1, 0},
+  {&__pyx_n_s_prepare, __pyx_k_prepare, sizeof(__pyx_k_prepare), 0, 0, 1, 1},
+  {&__pyx_n_s_product, __pyx_k_product, sizeof(__pyx_k_product), 0, 0, 1, 1},
+  {&__pyx_n_s_qd, __pyx_k_qd, sizeof(__pyx_k_qd), 0, 0, 1, 1},
+  {&__pyx_n_s_qmeq_approach_elph_c_redfield, __pyx_k_qmeq_approach_elph_c_redfield, sizeof(__pyx_k_qmeq_approach_elph_c_redfield), 0, 0, 1, 1},
+  {&__pyx_kp_s_qmeq_approach_elph_c_redfield_py, __pyx_k_qmeq_approach_elph_c_redfield_py, sizeof(__pyx_k_qmeq_approach_elph_c_redfield_py), 0, 0, 1, 0},
+  {&__pyx_n_s_qualname, __pyx_k_qualname, sizeof(__pyx_k_qualname), 0, 0, 1, 1},
+  {&__pyx_n_s_range, __pyx_k_range, sizeof(__pyx_k_range), 0, 0, 1, 1},
+  {&__pyx_n_s_self, __pyx_k_self, sizeof(__pyx_k_self), 0, 0, 1, 1},
+  {&__pyx_n_s_shiftlst0, __pyx_k_shiftlst0, sizeof(__pyx_k_shiftlst0), 0, 0, 1, 1},
+  {&__pyx_n_s_si, __pyx_k_si, sizeof(__pyx_k_si), 0, 0, 1, 1},
+  {&__pyx_n_s_si_elph, __pyx_k_si_elph, sizeof(__pyx_k_si_elph), 0, 0, 1, 1},
+  {&__pyx_n_s_statesdm, __pyx_k_statesdm, sizeof(__pyx_k_statesdm), 0, 0, 1, 1},
+  {&__pyx_n_s_test, __pyx_k_test, sizeof(__pyx_k_test), 0, 0, 1, 1},
+  {&__pyx_n_s_w1fct, __pyx_k_w1fct, sizeof(__pyx_k_w1fct), 0, 0, 1, 1},
+  {&__pyx_n_s_zeros, __pyx_k_zeros, sizeof(__pyx_k_zeros), 0, 0, 1, 1},
+  {0, 0, 0, 0, 0, 0, 0}
+};
+static CYTHON_SMALL_CODE int __Pyx_InitCachedBuiltins(void) {
+  __pyx_builtin_range = __Pyx_GetBuiltinName(__pyx_n_s_range); if (!__pyx_builtin_range) __PYX_ERR(0, 72, __pyx_L1_error)
+  __pyx_builtin_ImportError = __Pyx_GetBuiltinName(__pyx_n_s_ImportError); if (!__pyx_builtin_ImportError) __PYX_ERR(1, 944, __pyx_L1_error)
+  return 0;
+  __pyx_L1_error:;
+  return -1;
+}
+
+static CYTHON_SMALL_CODE int __Pyx_InitCachedConstants(void) {
+  __Pyx_RefNannyDeclarations
+  __Pyx_RefNannySetupContext("__Pyx_InitCachedConstants", 0);
+
+  /* "qmeq/approach/elph/c_redfield.pyx":68
+ *     if self.kern is None:
+ *         self.kern_ext = np.zeros((ndm0r+1, ndm0r), dtype=doublenp)
+ *         self.kern = self.kern_ext[0:-1, :]             # <<<<<<<<<<<<<<
+ *         generate_norm_vec(self, ndm0r)
+ * 
+ */
+  __pyx_slice_ = PySlice_New(__pyx_int_0, __pyx_int_neg_1, Py_None); if (unlikely(!__pyx_slice_)) __PYX_ERR(0, 68, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_slice_);
+  __Pyx_GIVEREF(__pyx_slice_);
+  __pyx_slice__2 = PySlice_New(Py_None, Py_None, Py_None); if (unlikely(!__pyx_slice__2)) __PYX_ERR(0, 68, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_slice__2);
+  __Pyx_GIVEREF(__pyx_slice__2);
+  __pyx_tuple__3 = PyTuple_Pack(2, __pyx_slice_, __pyx_slice__2); if (unlikely(!__pyx_tuple__3)) __PYX_ERR(0, 68, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_tuple__3);
+  __Pyx_GIVEREF(__pyx_tuple__3);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":944
+ *         __pyx_import_array()
+ *     except Exception:
+ *         raise ImportError("numpy.core.multiarray failed to import")             # <<<<<<<<<<<<<<
+ * 
+ * cdef inline int import_umath() except -1:
+ */
+  __pyx_tuple__4 = PyTuple_Pack(1, __pyx_kp_s_numpy_core_multiarray_failed_to); if (unlikely(!__pyx_tuple__4)) __PYX_ERR(1, 944, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_tuple__4);
+  __Pyx_GIVEREF(__pyx_tuple__4);
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":950
+ *         _import_umath()
+ *     except Exception:
+ *         raise ImportError("numpy.core.umath failed to import")             # <<<<<<<<<<<<<<
+ * 
+ * cdef inline int import_ufunc() except -1:
+ */
+  __pyx_tuple__5 = PyTuple_Pack(1, __pyx_kp_s_numpy_core_umath_failed_to_impor); if (unlikely(!__pyx_tuple__5)) __PYX_ERR(1, 950, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_tuple__5);
+  __Pyx_GIVEREF(__pyx_tuple__5);
+
+  /* "qmeq/approach/elph/c_redfield.pyx":36
+ * # ---------------------------------------------------------------------------------------------------------
+ * @cython.boundscheck(False)
+ * def generate_kern_redfield_elph(self):             # <<<<<<<<<<<<<<
+ *     cdef np.ndarray[double_t, ndim=1] E = self.qd.Ea
+ *     cdef np.ndarray[complex_t, ndim=3] Vbbp = self.baths.Vbbp
+ */
+  __pyx_tuple__6 = PyTuple_Pack(60, __pyx_n_s_self, __pyx_n_s_E, __pyx_n_s_Vbbp, __pyx_n_s_w1fct, __pyx_n_s_si, __pyx_n_s_si_elph, __pyx_n_s_bbp_bool, __pyx_n_s_bbpi_bool, __pyx_n_s_charge, __pyx_n_s_l, __pyx_n_s_nbaths, __pyx_n_s_aap_sgn, __pyx_n_s_bppbp_sgn, __pyx_n_s_bbpp_sgn, __pyx_n_s_ccp_sgn, __pyx_n_s_b, __pyx_n_s_bp, __pyx_n_s_bbp, __pyx_n_s_bbpi, __pyx_n_s_bb, __pyx_n_s_a, __pyx_n_s_ap, __pyx_n_s_aap, __pyx_n_s_aapi, __pyx_n_s_bpp, __pyx_n_s_bppbp, __pyx_n_s_bppbpi, __pyx_n_s_bbpp, __pyx_n_s_bbppi, __pyx_n_s_c, __pyx_n_s_cp, __pyx_n_s_ccp, __pyx_n_s_ccpi, __pyx_n_s_bpap, __pyx_n_s_ba, __pyx_n_s_bppa, __pyx_n_s_cbpp, __pyx_n_s_cpbp, __pyx_n_s_cb, __pyx_n_s_ndm0, __pyx_n_s_ndm0r, __pyx_n_s_npauli, __pyx_n_s_fct_aap, __pyx_n_s_fct_bppbp, __pyx_n_s_fct_bbpp, __pyx_n_s_fct_ccp, __pyx_n_s_gamma_ba_bpap, __pyx_n_s_gamma_ba_bppa, __pyx_n_s_gamma_bc_bppc, __pyx_n_s_gamma_abpp_abp, __pyx_n_s_gamma_cbpp_cbp, __pyx_n_s_gamma_bc_bpcp, __pyx_n_s_lenlst, __pyx_n_s_dictdm, __pyx_n_s_shiftlst0, __pyx_n_s_mapdm0, __pyx_n_s_booldm0, __pyx_n_s_conjdm0, __pyx_n_s_mapdm0_2, __pyx_n_s_kern); if (unlikely(!__pyx_tuple__6)) __PYX_ERR(0, 36, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_tuple__6);
+  __Pyx_GIVEREF(__pyx_tuple__6);
+  __pyx_codeobj__7 = (PyObject*)__Pyx_PyCode_New(1, 0, 60, 0, CO_OPTIMIZED|CO_NEWLOCALS, __pyx_empty_bytes, __pyx_empty_tuple, __pyx_empty_tuple, __pyx_tuple__6, __pyx_empty_tuple, __pyx_empty_tuple, __pyx_kp_s_qmeq_approach_elph_c_redfield_py, __pyx_n_s_generate_kern_redfield_elph, 36, __pyx_empty_bytes); if (unlikely(!__pyx_codeobj__7)) __PYX_ERR(0, 36, __pyx_L1_error)
+  __Pyx_RefNannyFinishContext();
+  return 0;
+  __pyx_L1_error:;
+  __Pyx_RefNannyFinishContext();
+  return -1;
+}
+
+static CYTHON_SMALL_CODE int __Pyx_InitGlobals(void) {
+  if (__Pyx_InitStrings(__pyx_string_tab) < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  __pyx_int_0 = PyInt_FromLong(0); if (unlikely(!__pyx_int_0)) __PYX_ERR(0, 1, __pyx_L1_error)
+  __pyx_int_2 = PyInt_FromLong(2); if (unlikely(!__pyx_int_2)) __PYX_ERR(0, 1, __pyx_L1_error)
+  __pyx_int_neg_1 = PyInt_FromLong(-1); if (unlikely(!__pyx_int_neg_1)) __PYX_ERR(0, 1, __pyx_L1_error)
+  return 0;
+  __pyx_L1_error:;
+  return -1;
+}
+
+static CYTHON_SMALL_CODE int __Pyx_modinit_global_init_code(void); /*proto*/
+static CYTHON_SMALL_CODE int __Pyx_modinit_variable_export_code(void); /*proto*/
+static CYTHON_SMALL_CODE int __Pyx_modinit_function_export_code(void); /*proto*/
+static CYTHON_SMALL_CODE int __Pyx_modinit_type_init_code(void); /*proto*/
+static CYTHON_SMALL_CODE int __Pyx_modinit_type_import_code(void); /*proto*/
+static CYTHON_SMALL_CODE int __Pyx_modinit_variable_import_code(void); /*proto*/
+static CYTHON_SMALL_CODE int __Pyx_modinit_function_import_code(void); /*proto*/
+
+static int __Pyx_modinit_global_init_code(void) {
+  __Pyx_RefNannyDeclarations
+  __Pyx_RefNannySetupContext("__Pyx_modinit_global_init_code", 0);
+  /*--- Global init code ---*/
+  __Pyx_RefNannyFinishContext();
+  return 0;
+}
+
+static int __Pyx_modinit_variable_export_code(void) {
+  __Pyx_RefNannyDeclarations
+  __Pyx_RefNannySetupContext("__Pyx_modinit_variable_export_code", 0);
+  /*--- Variable export code ---*/
+  __Pyx_RefNannyFinishContext();
+  return 0;
+}
+
+static int __Pyx_modinit_function_export_code(void) {
+  __Pyx_RefNannyDeclarations
+  __Pyx_RefNannySetupContext("__Pyx_modinit_function_export_code", 0);
+  /*--- Function export code ---*/
+  __Pyx_RefNannyFinishContext();
+  return 0;
+}
+
+static int __Pyx_modinit_type_init_code(void) {
+  __Pyx_RefNannyDeclarations
+  __Pyx_RefNannySetupContext("__Pyx_modinit_type_init_code", 0);
+  /*--- Type init code ---*/
+  __Pyx_RefNannyFinishContext();
+  return 0;
+}
+
+static int __Pyx_modinit_type_import_code(void) {
+  __Pyx_RefNannyDeclarations
+  PyObject *__pyx_t_1 = NULL;
+  int __pyx_lineno = 0;
+  const char *__pyx_filename = NULL;
+  int __pyx_clineno = 0;
+  __Pyx_RefNannySetupContext("__Pyx_modinit_type_import_code", 0);
+  /*--- Type import code ---*/
+  __pyx_t_1 = PyImport_ImportModule(__Pyx_BUILTIN_MODULE_NAME); if (unlikely(!__pyx_t_1)) __PYX_ERR(2, 9, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __pyx_ptype_7cpython_4type_type = __Pyx_ImportType_0_29_37(__pyx_t_1, __Pyx_BUILTIN_MODULE_NAME, "type", 
+  #if defined(PYPY_VERSION_NUM) && PYPY_VERSION_NUM < 0x050B0000
+  sizeof(PyTypeObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyTypeObject),
+  #else
+  sizeof(PyHeapTypeObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyHeapTypeObject),
+  #endif
+  __Pyx_ImportType_CheckSize_Warn_0_29_37); if (!__pyx_ptype_7cpython_4type_type) __PYX_ERR(2, 9, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+  __pyx_t_1 = PyImport_ImportModule("numpy"); if (unlikely(!__pyx_t_1)) __PYX_ERR(1, 199, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __pyx_ptype_5numpy_dtype = __Pyx_ImportType_0_29_37(__pyx_t_1, "numpy", "dtype", sizeof(PyArray_Descr), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyArray_Descr),__Pyx_ImportType_CheckSize_Ignore_0_29_37); if (!__pyx_ptype_5numpy_dtype) __PYX_ERR(1, 199, __pyx_L1_error)
+  __pyx_ptype_5numpy_flatiter = __Pyx_ImportType_0_29_37(__pyx_t_1, "numpy", "flatiter", sizeof(PyArrayIterObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyArrayIterObject),__Pyx_ImportType_CheckSize_Ignore_0_29_37); if (!__pyx_ptype_5numpy_flatiter) __PYX_ERR(1, 222, __pyx_L1_error)
+  __pyx_ptype_5numpy_broadcast = __Pyx_ImportType_0_29_37(__pyx_t_1, "numpy", "broadcast", sizeof(PyArrayMultiIterObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyArrayMultiIterObject),__Pyx_ImportType_CheckSize_Ignore_0_29_37); if (!__pyx_ptype_5numpy_broadcast) __PYX_ERR(1, 226, __pyx_L1_error)
+  __pyx_ptype_5numpy_ndarray = __Pyx_ImportType_0_29_37(__pyx_t_1, "numpy", "ndarray", sizeof(PyArrayObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyArrayObject),__Pyx_ImportType_CheckSize_Ignore_0_29_37); if (!__pyx_ptype_5numpy_ndarray) __PYX_ERR(1, 238, __pyx_L1_error)
+  __pyx_ptype_5numpy_generic = __Pyx_ImportType_0_29_37(__pyx_t_1, "numpy", "generic", sizeof(PyObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyObject),__Pyx_ImportType_CheckSize_Warn_0_29_37); if (!__pyx_ptype_5numpy_generic) __PYX_ERR(1, 770, __pyx_L1_error)
+  __pyx_ptype_5numpy_number = __Pyx_ImportType_0_29_37(__pyx_t_1, "numpy", "number", sizeof(PyObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyObject),__Pyx_ImportType_CheckSize_Warn_0_29_37); if (!__pyx_ptype_5numpy_number) __PYX_ERR(1, 772, __pyx_L1_error)
+  __pyx_ptype_5numpy_integer = __Pyx_ImportType_0_29_37(__pyx_t_1, "numpy", "integer", sizeof(PyObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyObject),__Pyx_ImportType_CheckSize_Warn_0_29_37); if (!__pyx_ptype_5numpy_integer) __PYX_ERR(1, 774, __pyx_L1_error)
+  __pyx_ptype_5numpy_signedinteger = __Pyx_ImportType_0_29_37(__pyx_t_1, "numpy", "signedinteger", sizeof(PyObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyObject),__Pyx_ImportType_CheckSize_Warn_0_29_37); if (!__pyx_ptype_5numpy_signedinteger) __PYX_ERR(1, 776, __pyx_L1_error)
+  __pyx_ptype_5numpy_unsignedinteger = __Pyx_ImportType_0_29_37(__pyx_t_1, "numpy", "unsignedinteger", sizeof(PyObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyObject),__Pyx_ImportType_CheckSize_Warn_0_29_37); if (!__pyx_ptype_5numpy_unsignedinteger) __PYX_ERR(1, 778, __pyx_L1_error)
+  __pyx_ptype_5numpy_inexact = __Pyx_ImportType_0_29_37(__pyx_t_1, "numpy", "inexact", sizeof(PyObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyObject),__Pyx_ImportType_CheckSize_Warn_0_29_37); if (!__pyx_ptype_5numpy_inexact) __PYX_ERR(1, 780, __pyx_L1_error)
+  __pyx_ptype_5numpy_floating = __Pyx_ImportType_0_29_37(__pyx_t_1, "numpy", "floating", sizeof(PyObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyObject),__Pyx_ImportType_CheckSize_Warn_0_29_37); if (!__pyx_ptype_5numpy_floating) __PYX_ERR(1, 782, __pyx_L1_error)
+  __pyx_ptype_5numpy_complexfloating = __Pyx_ImportType_0_29_37(__pyx_t_1, "numpy", "complexfloating", sizeof(PyObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyObject),__Pyx_ImportType_CheckSize_Warn_0_29_37); if (!__pyx_ptype_5numpy_complexfloating) __PYX_ERR(1, 784, __pyx_L1_error)
+  __pyx_ptype_5numpy_flexible = __Pyx_ImportType_0_29_37(__pyx_t_1, "numpy", "flexible", sizeof(PyObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyObject),__Pyx_ImportType_CheckSize_Warn_0_29_37); if (!__pyx_ptype_5numpy_flexible) __PYX_ERR(1, 786, __pyx_L1_error)
+  __pyx_ptype_5numpy_character = __Pyx_ImportType_0_29_37(__pyx_t_1, "numpy", "character", sizeof(PyObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyObject),__Pyx_ImportType_CheckSize_Warn_0_29_37); if (!__pyx_ptype_5numpy_character) __PYX_ERR(1, 788, __pyx_L1_error)
+  __pyx_ptype_5numpy_ufunc = __Pyx_ImportType_0_29_37(__pyx_t_1, "numpy", "ufunc", sizeof(PyUFuncObject), __PYX_GET_STRUCT_ALIGNMENT_0_29_37(PyUFuncObject),__Pyx_ImportType_CheckSize_Ignore_0_29_37); if (!__pyx_ptype_5numpy_ufunc) __PYX_ERR(1, 826, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+  __Pyx_RefNannyFinishContext();
+  return 0;
+  __pyx_L1_error:;
+  __Pyx_XDECREF(__pyx_t_1);
+  __Pyx_RefNannyFinishContext();
+  return -1;
+}
+
+static int __Pyx_modinit_variable_import_code(void) {
+  __Pyx_RefNannyDeclarations
+  __Pyx_RefNannySetupContext("__Pyx_modinit_variable_import_code", 0);
+  /*--- Variable import code ---*/
+  __Pyx_RefNannyFinishContext();
+  return 0;
+}
+
+static int __Pyx_modinit_function_import_code(void) {
+  __Pyx_RefNannyDeclarations
+  __Pyx_RefNannySetupContext("__Pyx_modinit_function_import_code", 0);
+  /*--- Function import code ---*/
+  __Pyx_RefNannyFinishContext();
+  return 0;
+}
+
+
+#ifndef CYTHON_NO_PYINIT_EXPORT
+#define __Pyx_PyMODINIT_FUNC PyMODINIT_FUNC
+#elif PY_MAJOR_VERSION < 3
+#ifdef __cplusplus
+#define __Pyx_PyMODINIT_FUNC extern "C" void
+#else
+#define __Pyx_PyMODINIT_FUNC void
+#endif
+#else
+#ifdef __cplusplus
+#define __Pyx_PyMODINIT_FUNC extern "C" PyObject *
+#else
+#define __Pyx_PyMODINIT_FUNC PyObject *
+#endif
+#endif
+
+
+#if PY_MAJOR_VERSION < 3
+__Pyx_PyMODINIT_FUNC initc_redfield(void) CYTHON_SMALL_CODE; /*proto*/
+__Pyx_PyMODINIT_FUNC initc_redfield(void)
+#else
+__Pyx_PyMODINIT_FUNC PyInit_c_redfield(void) CYTHON_SMALL_CODE; /*proto*/
+__Pyx_PyMODINIT_FUNC PyInit_c_redfield(void)
+#if CYTHON_PEP489_MULTI_PHASE_INIT
+{
+  return PyModuleDef_Init(&__pyx_moduledef);
+}
+static CYTHON_SMALL_CODE int __Pyx_check_single_interpreter(void) {
+    #if PY_VERSION_HEX >= 0x030700A1
+    static PY_INT64_T main_interpreter_id = -1;
+    PY_INT64_T current_id = PyInterpreterState_GetID(PyThreadState_Get()->interp);
+    if (main_interpreter_id == -1) {
+        main_interpreter_id = current_id;
+        return (unlikely(current_id == -1)) ? -1 : 0;
+    } else if (unlikely(main_interpreter_id != current_id))
+    #else
+    static PyInterpreterState *main_interpreter = NULL;
+    PyInterpreterState *current_interpreter = PyThreadState_Get()->interp;
+    if (!main_interpreter) {
+        main_interpreter = current_interpreter;
+    } else if (unlikely(main_interpreter != current_interpreter))
+    #endif
+    {
+        PyErr_SetString(
+            PyExc_ImportError,
+            "Interpreter change detected - this module can only be loaded into one interpreter per process.");
+        return -1;
+    }
+    return 0;
+}
+static CYTHON_SMALL_CODE int __Pyx_copy_spec_to_module(PyObject *spec, PyObject *moddict, const char* from_name, const char* to_name, int allow_none) {
+    PyObject *value = PyObject_GetAttrString(spec, from_name);
+    int result = 0;
+    if (likely(value)) {
+        if (allow_none || value != Py_None) {
+            result = PyDict_SetItemString(moddict, to_name, value);
+        }
+        Py_DECREF(value);
+    } else if (PyErr_ExceptionMatches(PyExc_AttributeError)) {
+        PyErr_Clear();
+    } else {
+        result = -1;
+    }
+    return result;
+}
+static CYTHON_SMALL_CODE PyObject* __pyx_pymod_create(PyObject *spec, CYTHON_UNUSED PyModuleDef *def) {
+    PyObject *module = NULL, *moddict, *modname;
+    if (__Pyx_check_single_interpreter())
+        return NULL;
+    if (__pyx_m)
+        return __Pyx_NewRef(__pyx_m);
+    modname = PyObject_GetAttrString(spec, "name");
+    if (unlikely(!modname)) goto bad;
+    module = PyModule_NewObject(modname);
+    Py_DECREF(modname);
+    if (unlikely(!module)) goto bad;
+    moddict = PyModule_GetDict(module);
+    if (unlikely(!moddict)) goto bad;
+    if (unlikely(__Pyx_copy_spec_to_module(spec, moddict, "loader", "__loader__", 1) < 0)) goto bad;
+    if (unlikely(__Pyx_copy_spec_to_module(spec, moddict, "origin", "__file__", 1) < 0)) goto bad;
+    if (unlikely(__Pyx_copy_spec_to_module(spec, moddict, "parent", "__package__", 1) < 0)) goto bad;
+    if (unlikely(__Pyx_copy_spec_to_module(spec, moddict, "submodule_search_locations", "__path__", 0) < 0)) goto bad;
+    return module;
+bad:
+    Py_XDECREF(module);
+    return NULL;
+}
+
+
+static CYTHON_SMALL_CODE int __pyx_pymod_exec_c_redfield(PyObject *__pyx_pyinit_module)
+#endif
+#endif
+{
+  PyObject *__pyx_t_1 = NULL;
+  PyObject *__pyx_t_2 = NULL;
+  PyObject *__pyx_t_3 = NULL;
+  PyObject *__pyx_t_4 = NULL;
+  int __pyx_lineno = 0;
+  const char *__pyx_filename = NULL;
+  int __pyx_clineno = 0;
+  __Pyx_RefNannyDeclarations
+  #if CYTHON_PEP489_MULTI_PHASE_INIT
+  if (__pyx_m) {
+    if (__pyx_m == __pyx_pyinit_module) return 0;
+    PyErr_SetString(PyExc_RuntimeError, "Module 'c_redfield' has already been imported. Re-initialisation is not supported.");
+    return -1;
+  }
+  #elif PY_MAJOR_VERSION >= 3
+  if (__pyx_m) return __Pyx_NewRef(__pyx_m);
+  #endif
+  #if CYTHON_REFNANNY
+__Pyx_RefNanny = __Pyx_RefNannyImportAPI("refnanny");
+if (!__Pyx_RefNanny) {
+  PyErr_Clear();
+  __Pyx_RefNanny = __Pyx_RefNannyImportAPI("Cython.Runtime.refnanny");
+  if (!__Pyx_RefNanny)
+      Py_FatalError("failed to import 'refnanny' module");
+}
+#endif
+  __Pyx_RefNannySetupContext("__Pyx_PyMODINIT_FUNC PyInit_c_redfield(void)", 0);
+  if (__Pyx_check_binary_version() < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  #ifdef __Pxy_PyFrame_Initialize_Offsets
+  __Pxy_PyFrame_Initialize_Offsets();
+  #endif
+  __pyx_empty_tuple = PyTuple_New(0); if (unlikely(!__pyx_empty_tuple)) __PYX_ERR(0, 1, __pyx_L1_error)
+  __pyx_empty_bytes = PyBytes_FromStringAndSize("", 0); if (unlikely(!__pyx_empty_bytes)) __PYX_ERR(0, 1, __pyx_L1_error)
+  __pyx_empty_unicode = PyUnicode_FromStringAndSize("", 0); if (unlikely(!__pyx_empty_unicode)) __PYX_ERR(0, 1, __pyx_L1_error)
+  #ifdef __Pyx_CyFunction_USED
+  if (__pyx_CyFunction_init() < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  #endif
+  #ifdef __Pyx_FusedFunction_USED
+  if (__pyx_FusedFunction_init() < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  #endif
+  #ifdef __Pyx_Coroutine_USED
+  if (__pyx_Coroutine_init() < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  #endif
+  #ifdef __Pyx_Generator_USED
+  if (__pyx_Generator_init() < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  #endif
+  #ifdef __Pyx_AsyncGen_USED
+  if (__pyx_AsyncGen_init() < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  #endif
+  #ifdef __Pyx_StopAsyncIteration_USED
+  if (__pyx_StopAsyncIteration_init() < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  #endif
+  /*--- Library function declarations ---*/
+  /*--- Threads initialization code ---*/
+  #if defined(WITH_THREAD) && PY_VERSION_HEX < 0x030700F0 && defined(__PYX_FORCE_INIT_THREADS) && __PYX_FORCE_INIT_THREADS
+  PyEval_InitThreads();
+  #endif
+  /*--- Module creation code ---*/
+  #if CYTHON_PEP489_MULTI_PHASE_INIT
+  __pyx_m = __pyx_pyinit_module;
+  Py_INCREF(__pyx_m);
+  #else
+  #if PY_MAJOR_VERSION < 3
+  __pyx_m = Py_InitModule4("c_redfield", __pyx_methods, __pyx_k_Module_containing_cython_functio, 0, PYTHON_API_VERSION); Py_XINCREF(__pyx_m);
+  #else
+  __pyx_m = PyModule_Create(&__pyx_moduledef);
+  #endif
+  if (unlikely(!__pyx_m)) __PYX_ERR(0, 1, __pyx_L1_error)
+  #endif
+  __pyx_d = PyModule_GetDict(__pyx_m); if (unlikely(!__pyx_d)) __PYX_ERR(0, 1, __pyx_L1_error)
+  Py_INCREF(__pyx_d);
+  __pyx_b = PyImport_AddModule(__Pyx_BUILTIN_MODULE_NAME); if (unlikely(!__pyx_b)) __PYX_ERR(0, 1, __pyx_L1_error)
+  Py_INCREF(__pyx_b);
+  __pyx_cython_runtime = PyImport_AddModule((char *) "cython_runtime"); if (unlikely(!__pyx_cython_runtime)) __PYX_ERR(0, 1, __pyx_L1_error)
+  Py_INCREF(__pyx_cython_runtime);
+  if (PyObject_SetAttrString(__pyx_m, "__builtins__", __pyx_b) < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  /*--- Initialize various global constants etc. ---*/
+  if (__Pyx_InitGlobals() < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  #if PY_MAJOR_VERSION < 3 && (__PYX_DEFAULT_STRING_ENCODING_IS_ASCII || __PYX_DEFAULT_STRING_ENCODING_IS_DEFAULT)
+  if (__Pyx_init_sys_getdefaultencoding_params() < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  #endif
+  if (__pyx_module_is_main_qmeq__approach__elph__c_redfield) {
+    if (PyObject_SetAttr(__pyx_m, __pyx_n_s_name, __pyx_n_s_main) < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  }
+  #if PY_MAJOR_VERSION >= 3
+  {
+    PyObject *modules = PyImport_GetModuleDict(); if (unlikely(!modules)) __PYX_ERR(0, 1, __pyx_L1_error)
+    if (!PyDict_GetItemString(modules, "qmeq.approach.elph.c_redfield")) {
+      if (unlikely(PyDict_SetItemString(modules, "qmeq.approach.elph.c_redfield", __pyx_m) < 0)) __PYX_ERR(0, 1, __pyx_L1_error)
+    }
+  }
+  #endif
+  /*--- Builtin init code ---*/
+  if (__Pyx_InitCachedBuiltins() < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  /*--- Constants init code ---*/
+  if (__Pyx_InitCachedConstants() < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  /*--- Global type/function init code ---*/
+  (void)__Pyx_modinit_global_init_code();
+  (void)__Pyx_modinit_variable_export_code();
+  (void)__Pyx_modinit_function_export_code();
+  (void)__Pyx_modinit_type_init_code();
+  if (unlikely(__Pyx_modinit_type_import_code() < 0)) __PYX_ERR(0, 1, __pyx_L1_error)
+  (void)__Pyx_modinit_variable_import_code();
+  (void)__Pyx_modinit_function_import_code();
+  /*--- Execution code ---*/
+  #if defined(__Pyx_Generator_USED) || defined(__Pyx_Coroutine_USED)
+  if (__Pyx_patch_abc() < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  #endif
+
+  /* "qmeq/approach/elph/c_redfield.pyx":7
+ * from __future__ import division
+ * from __future__ import print_function
+ * import numpy as np             # <<<<<<<<<<<<<<
+ * import itertools
+ * 
+ */
+  __pyx_t_1 = __Pyx_Import(__pyx_n_s_numpy, 0, 0); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 7, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  if (PyDict_SetItem(__pyx_d, __pyx_n_s_np, __pyx_t_1) < 0) __PYX_ERR(0, 7, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":8
+ * from __future__ import print_function
+ * import numpy as np
+ * import itertools             # <<<<<<<<<<<<<<
+ * 
+ * from .c_neumann1 import generate_w1fct_elph
+ */
+  __pyx_t_1 = __Pyx_Import(__pyx_n_s_itertools, 0, 0); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 8, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  if (PyDict_SetItem(__pyx_d, __pyx_n_s_itertools, __pyx_t_1) < 0) __PYX_ERR(0, 8, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":10
+ * import itertools
+ * 
+ * from .c_neumann1 import generate_w1fct_elph             # <<<<<<<<<<<<<<
+ * from ...aprclass import ApproachElPh
+ * 
+ */
+  __pyx_t_1 = PyList_New(1); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 10, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __Pyx_INCREF(__pyx_n_s_generate_w1fct_elph);
+  __Pyx_GIVEREF(__pyx_n_s_generate_w1fct_elph);
+  PyList_SET_ITEM(__pyx_t_1, 0, __pyx_n_s_generate_w1fct_elph);
+  __pyx_t_2 = __Pyx_Import(__pyx_n_s_c_neumann1, __pyx_t_1, 1); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 10, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+  __pyx_t_1 = __Pyx_ImportFrom(__pyx_t_2, __pyx_n_s_generate_w1fct_elph); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 10, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  if (PyDict_SetItem(__pyx_d, __pyx_n_s_generate_w1fct_elph, __pyx_t_1) < 0) __PYX_ERR(0, 10, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":11
+ * 
+ * from .c_neumann1 import generate_w1fct_elph
+ * from ...aprclass import ApproachElPh             # <<<<<<<<<<<<<<
+ * 
+ * from ...mytypes import doublenp
+ */
+  __pyx_t_2 = PyList_New(1); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 11, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __Pyx_INCREF(__pyx_n_s_ApproachElPh);
+  __Pyx_GIVEREF(__pyx_n_s_ApproachElPh);
+  PyList_SET_ITEM(__pyx_t_2, 0, __pyx_n_s_ApproachElPh);
+  __pyx_t_1 = __Pyx_Import(__pyx_n_s_aprclass, __pyx_t_2, 3); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 11, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+  __pyx_t_2 = __Pyx_ImportFrom(__pyx_t_1, __pyx_n_s_ApproachElPh); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 11, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  if (PyDict_SetItem(__pyx_d, __pyx_n_s_ApproachElPh, __pyx_t_2) < 0) __PYX_ERR(0, 11, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":13
+ * from ...aprclass import ApproachElPh
+ * 
+ * from ...mytypes import doublenp             # <<<<<<<<<<<<<<
+ * from ...mytypes import complexnp
+ * 
+ */
+  __pyx_t_1 = PyList_New(1); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 13, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __Pyx_INCREF(__pyx_n_s_doublenp);
+  __Pyx_GIVEREF(__pyx_n_s_doublenp);
+  PyList_SET_ITEM(__pyx_t_1, 0, __pyx_n_s_doublenp);
+  __pyx_t_2 = __Pyx_Import(__pyx_n_s_mytypes, __pyx_t_1, 3); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 13, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+  __pyx_t_1 = __Pyx_ImportFrom(__pyx_t_2, __pyx_n_s_doublenp); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 13, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  if (PyDict_SetItem(__pyx_d, __pyx_n_s_doublenp, __pyx_t_1) < 0) __PYX_ERR(0, 13, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":14
+ * 
+ * from ...mytypes import doublenp
+ * from ...mytypes import complexnp             # <<<<<<<<<<<<<<
+ * 
+ * from ..base.c_neumann1 import generate_phi1fct
+ */
+  __pyx_t_2 = PyList_New(1); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 14, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __Pyx_INCREF(__pyx_n_s_complexnp);
+  __Pyx_GIVEREF(__pyx_n_s_complexnp);
+  PyList_SET_ITEM(__pyx_t_2, 0, __pyx_n_s_complexnp);
+  __pyx_t_1 = __Pyx_Import(__pyx_n_s_mytypes, __pyx_t_2, 3); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 14, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+  __pyx_t_2 = __Pyx_ImportFrom(__pyx_t_1, __pyx_n_s_complexnp); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 14, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  if (PyDict_SetItem(__pyx_d, __pyx_n_s_complexnp, __pyx_t_2) < 0) __PYX_ERR(0, 14, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":16
+ * from ...mytypes import complexnp
+ * 
+ * from ..base.c_neumann1 import generate_phi1fct             # <<<<<<<<<<<<<<
+ * from ..base.c_redfield import generate_kern_redfield
+ * from ..base.c_redfield import generate_current_redfield
+ */
+  __pyx_t_1 = PyList_New(1); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 16, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __Pyx_INCREF(__pyx_n_s_generate_phi1fct);
+  __Pyx_GIVEREF(__pyx_n_s_generate_phi1fct);
+  PyList_SET_ITEM(__pyx_t_1, 0, __pyx_n_s_generate_phi1fct);
+  __pyx_t_2 = __Pyx_Import(__pyx_n_s_base_c_neumann1, __pyx_t_1, 2); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 16, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+  __pyx_t_1 = __Pyx_ImportFrom(__pyx_t_2, __pyx_n_s_generate_phi1fct); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 16, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  if (PyDict_SetItem(__pyx_d, __pyx_n_s_generate_phi1fct, __pyx_t_1) < 0) __PYX_ERR(0, 16, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":17
+ * 
+ * from ..base.c_neumann1 import generate_phi1fct
+ * from ..base.c_redfield import generate_kern_redfield             # <<<<<<<<<<<<<<
+ * from ..base.c_redfield import generate_current_redfield
+ * from ..base.c_redfield import generate_vec_redfield
+ */
+  __pyx_t_2 = PyList_New(1); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 17, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __Pyx_INCREF(__pyx_n_s_generate_kern_redfield);
+  __Pyx_GIVEREF(__pyx_n_s_generate_kern_redfield);
+  PyList_SET_ITEM(__pyx_t_2, 0, __pyx_n_s_generate_kern_redfield);
+  __pyx_t_1 = __Pyx_Import(__pyx_n_s_base_c_redfield, __pyx_t_2, 2); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 17, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+  __pyx_t_2 = __Pyx_ImportFrom(__pyx_t_1, __pyx_n_s_generate_kern_redfield); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 17, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  if (PyDict_SetItem(__pyx_d, __pyx_n_s_generate_kern_redfield, __pyx_t_2) < 0) __PYX_ERR(0, 17, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":18
+ * from ..base.c_neumann1 import generate_phi1fct
+ * from ..base.c_redfield import generate_kern_redfield
+ * from ..base.c_redfield import generate_current_redfield             # <<<<<<<<<<<<<<
+ * from ..base.c_redfield import generate_vec_redfield
+ * from ..base.c_pauli import generate_norm_vec
+ */
+  __pyx_t_1 = PyList_New(1); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 18, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __Pyx_INCREF(__pyx_n_s_generate_current_redfield);
+  __Pyx_GIVEREF(__pyx_n_s_generate_current_redfield);
+  PyList_SET_ITEM(__pyx_t_1, 0, __pyx_n_s_generate_current_redfield);
+  __pyx_t_2 = __Pyx_Import(__pyx_n_s_base_c_redfield, __pyx_t_1, 2); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 18, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+  __pyx_t_1 = __Pyx_ImportFrom(__pyx_t_2, __pyx_n_s_generate_current_redfield); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 18, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  if (PyDict_SetItem(__pyx_d, __pyx_n_s_generate_current_redfield, __pyx_t_1) < 0) __PYX_ERR(0, 18, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":19
+ * from ..base.c_redfield import generate_kern_redfield
+ * from ..base.c_redfield import generate_current_redfield
+ * from ..base.c_redfield import generate_vec_redfield             # <<<<<<<<<<<<<<
+ * from ..base.c_pauli import generate_norm_vec
+ * 
+ */
+  __pyx_t_2 = PyList_New(1); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 19, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __Pyx_INCREF(__pyx_n_s_generate_vec_redfield);
+  __Pyx_GIVEREF(__pyx_n_s_generate_vec_redfield);
+  PyList_SET_ITEM(__pyx_t_2, 0, __pyx_n_s_generate_vec_redfield);
+  __pyx_t_1 = __Pyx_Import(__pyx_n_s_base_c_redfield, __pyx_t_2, 2); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 19, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+  __pyx_t_2 = __Pyx_ImportFrom(__pyx_t_1, __pyx_n_s_generate_vec_redfield); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 19, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  if (PyDict_SetItem(__pyx_d, __pyx_n_s_generate_vec_redfield, __pyx_t_2) < 0) __PYX_ERR(0, 19, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":20
+ * from ..base.c_redfield import generate_current_redfield
+ * from ..base.c_redfield import generate_vec_redfield
+ * from ..base.c_pauli import generate_norm_vec             # <<<<<<<<<<<<<<
+ * 
+ * cimport numpy as np
+ */
+  __pyx_t_1 = PyList_New(1); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 20, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __Pyx_INCREF(__pyx_n_s_generate_norm_vec);
+  __Pyx_GIVEREF(__pyx_n_s_generate_norm_vec);
+  PyList_SET_ITEM(__pyx_t_1, 0, __pyx_n_s_generate_norm_vec);
+  __pyx_t_2 = __Pyx_Import(__pyx_n_s_base_c_pauli, __pyx_t_1, 2); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 20, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+  __pyx_t_1 = __Pyx_ImportFrom(__pyx_t_2, __pyx_n_s_generate_norm_vec); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 20, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  if (PyDict_SetItem(__pyx_d, __pyx_n_s_generate_norm_vec, __pyx_t_1) < 0) __PYX_ERR(0, 20, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":36
+ * # ---------------------------------------------------------------------------------------------------------
+ * @cython.boundscheck(False)
+ * def generate_kern_redfield_elph(self):             # <<<<<<<<<<<<<<
+ *     cdef np.ndarray[double_t, ndim=1] E = self.qd.Ea
+ *     cdef np.ndarray[complex_t, ndim=3] Vbbp = self.baths.Vbbp
+ */
+  __pyx_t_2 = PyCFunction_NewEx(&__pyx_mdef_4qmeq_8approach_4elph_10c_redfield_1generate_kern_redfield_elph, NULL, __pyx_n_s_qmeq_approach_elph_c_redfield); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 36, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  if (PyDict_SetItem(__pyx_d, __pyx_n_s_generate_kern_redfield_elph, __pyx_t_2) < 0) __PYX_ERR(0, 36, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":174
+ * 
+ * 
+ * class ApproachRedfield(ApproachElPh):             # <<<<<<<<<<<<<<
+ * 
+ *     kerntype = 'Redfield'
+ */
+  __Pyx_GetModuleGlobalName(__pyx_t_2, __pyx_n_s_ApproachElPh); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 174, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __pyx_t_1 = PyTuple_New(1); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 174, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  __Pyx_GIVEREF(__pyx_t_2);
+  PyTuple_SET_ITEM(__pyx_t_1, 0, __pyx_t_2);
+  __pyx_t_2 = 0;
+  __pyx_t_2 = __Pyx_CalculateMetaclass(NULL, __pyx_t_1); if (unlikely(!__pyx_t_2)) __PYX_ERR(0, 174, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_2);
+  __pyx_t_3 = __Pyx_Py3MetaclassPrepare(__pyx_t_2, __pyx_t_1, __pyx_n_s_ApproachRedfield, __pyx_n_s_ApproachRedfield, (PyObject *) NULL, __pyx_n_s_qmeq_approach_elph_c_redfield, (PyObject *) NULL); if (unlikely(!__pyx_t_3)) __PYX_ERR(0, 174, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_3);
+
+  /* "qmeq/approach/elph/c_redfield.pyx":176
+ * class ApproachRedfield(ApproachElPh):
+ * 
+ *     kerntype = 'Redfield'             # <<<<<<<<<<<<<<
+ *     generate_fct = generate_phi1fct
+ *     generate_kern = generate_kern_redfield
+ */
+  if (__Pyx_SetNameInClass(__pyx_t_3, __pyx_n_s_kerntype, __pyx_n_s_Redfield) < 0) __PYX_ERR(0, 176, __pyx_L1_error)
+
+  /* "qmeq/approach/elph/c_redfield.pyx":177
+ * 
+ *     kerntype = 'Redfield'
+ *     generate_fct = generate_phi1fct             # <<<<<<<<<<<<<<
+ *     generate_kern = generate_kern_redfield
+ *     generate_current = generate_current_redfield
+ */
+  __Pyx_GetModuleGlobalName(__pyx_t_4, __pyx_n_s_generate_phi1fct); if (unlikely(!__pyx_t_4)) __PYX_ERR(0, 177, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_4);
+  if (__Pyx_SetNameInClass(__pyx_t_3, __pyx_n_s_generate_fct, __pyx_t_4) < 0) __PYX_ERR(0, 177, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_4); __pyx_t_4 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":178
+ *     kerntype = 'Redfield'
+ *     generate_fct = generate_phi1fct
+ *     generate_kern = generate_kern_redfield             # <<<<<<<<<<<<<<
+ *     generate_current = generate_current_redfield
+ *     generate_vec = generate_vec_redfield
+ */
+  __Pyx_GetModuleGlobalName(__pyx_t_4, __pyx_n_s_generate_kern_redfield); if (unlikely(!__pyx_t_4)) __PYX_ERR(0, 178, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_4);
+  if (__Pyx_SetNameInClass(__pyx_t_3, __pyx_n_s_generate_kern, __pyx_t_4) < 0) __PYX_ERR(0, 178, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_4); __pyx_t_4 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":179
+ *     generate_fct = generate_phi1fct
+ *     generate_kern = generate_kern_redfield
+ *     generate_current = generate_current_redfield             # <<<<<<<<<<<<<<
+ *     generate_vec = generate_vec_redfield
+ *     #
+ */
+  __Pyx_GetModuleGlobalName(__pyx_t_4, __pyx_n_s_generate_current_redfield); if (unlikely(!__pyx_t_4)) __PYX_ERR(0, 179, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_4);
+  if (__Pyx_SetNameInClass(__pyx_t_3, __pyx_n_s_generate_current, __pyx_t_4) < 0) __PYX_ERR(0, 179, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_4); __pyx_t_4 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":180
+ *     generate_kern = generate_kern_redfield
+ *     generate_current = generate_current_redfield
+ *     generate_vec = generate_vec_redfield             # <<<<<<<<<<<<<<
+ *     #
+ *     generate_kern_elph = generate_kern_redfield_elph
+ */
+  __Pyx_GetModuleGlobalName(__pyx_t_4, __pyx_n_s_generate_vec_redfield); if (unlikely(!__pyx_t_4)) __PYX_ERR(0, 180, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_4);
+  if (__Pyx_SetNameInClass(__pyx_t_3, __pyx_n_s_generate_vec, __pyx_t_4) < 0) __PYX_ERR(0, 180, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_4); __pyx_t_4 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":182
+ *     generate_vec = generate_vec_redfield
+ *     #
+ *     generate_kern_elph = generate_kern_redfield_elph             # <<<<<<<<<<<<<<
+ *     generate_fct_elph = generate_w1fct_elph
+ */
+  __Pyx_GetModuleGlobalName(__pyx_t_4, __pyx_n_s_generate_kern_redfield_elph); if (unlikely(!__pyx_t_4)) __PYX_ERR(0, 182, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_4);
+  if (__Pyx_SetNameInClass(__pyx_t_3, __pyx_n_s_generate_kern_elph, __pyx_t_4) < 0) __PYX_ERR(0, 182, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_4); __pyx_t_4 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":183
+ *     #
+ *     generate_kern_elph = generate_kern_redfield_elph
+ *     generate_fct_elph = generate_w1fct_elph             # <<<<<<<<<<<<<<
+ */
+  __Pyx_GetModuleGlobalName(__pyx_t_4, __pyx_n_s_generate_w1fct_elph); if (unlikely(!__pyx_t_4)) __PYX_ERR(0, 183, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_4);
+  if (__Pyx_SetNameInClass(__pyx_t_3, __pyx_n_s_generate_fct_elph, __pyx_t_4) < 0) __PYX_ERR(0, 183, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_4); __pyx_t_4 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":174
+ * 
+ * 
+ * class ApproachRedfield(ApproachElPh):             # <<<<<<<<<<<<<<
+ * 
+ *     kerntype = 'Redfield'
+ */
+  __pyx_t_4 = __Pyx_Py3ClassCreate(__pyx_t_2, __pyx_n_s_ApproachRedfield, __pyx_t_1, __pyx_t_3, NULL, 0, 1); if (unlikely(!__pyx_t_4)) __PYX_ERR(0, 174, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_4);
+  if (PyDict_SetItem(__pyx_d, __pyx_n_s_ApproachRedfield, __pyx_t_4) < 0) __PYX_ERR(0, 174, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_4); __pyx_t_4 = 0;
+  __Pyx_DECREF(__pyx_t_3); __pyx_t_3 = 0;
+  __Pyx_DECREF(__pyx_t_2); __pyx_t_2 = 0;
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+
+  /* "qmeq/approach/elph/c_redfield.pyx":1
+ * """Module containing cython functions, which generate first order Redfield kernel.             # <<<<<<<<<<<<<<
+ *    For docstrings see documentation of module neumann1."""
+ * 
+ */
+  __pyx_t_1 = __Pyx_PyDict_NewPresized(0); if (unlikely(!__pyx_t_1)) __PYX_ERR(0, 1, __pyx_L1_error)
+  __Pyx_GOTREF(__pyx_t_1);
+  if (PyDict_SetItem(__pyx_d, __pyx_n_s_test, __pyx_t_1) < 0) __PYX_ERR(0, 1, __pyx_L1_error)
+  __Pyx_DECREF(__pyx_t_1); __pyx_t_1 = 0;
+
+  /* "../.pyenv/versions/3.11.7/lib/python3.11/site-packages/numpy/__init__.pxd":1013
+ * 
+ * 
+ * cdef inline NPY_DATETIMEUNIT get_datetime64_unit(object obj) nogil:             # <<<<<<<<<<<<<<
+ *     """
+ *     returns the unit part of the dtype for a numpy datetime64 object.
+ */
+
+  /*--- Wrapped vars code ---*/
+
+  goto __pyx_L0;
+  __pyx_L1_error:;
+  __Pyx_XDECREF(__pyx_t_1);
+  __Pyx_XDECREF(__pyx_t_2);
+  __Pyx_XDECREF(__pyx_t_3);
+  __Pyx_XDECREF(__pyx_t_4);
+  if (__pyx_m) {
+    if (__pyx_d) {
+      __Pyx_AddTraceback("init qmeq.approach.elph.c_redfield", __pyx_clineno, __pyx_lineno, __pyx_filename);
+    }
+    Py_CLEAR(__pyx_m);
+  } else if (!PyErr_Occurred()) {
+    PyErr_SetString(PyExc_ImportError, "init qmeq.approach.elph.c_redfield");
+  }
+  __pyx_L0:;
+  __Pyx_RefNannyFinishContext();
+  #if CYTHON_PEP489_MULTI_PHASE_INIT
+  return (__pyx_m != NULL) ? 0 : -1;
+  #elif PY_MAJOR_VERSION >= 3
+  return __pyx_m;
+  #else
+  return;
+  #endif
+}
+
+/* --- Runtime support code --- */
+/* Refnanny */
+#if CYTHON_REFNANNY
+static __Pyx_RefNannyAPIStruct *__Pyx_RefNannyImportAPI(const char *modname) {
+    PyObject *m = NULL, *p = NULL;
+    void *r = NULL;
+    m = PyImport_ImportModule(modname);
+    if (!m) goto end;
+    p = PyObject_GetAttrString(m, "RefNannyAPI");
+    if (!p) goto end;
+    r = PyLong_AsVoidPtr(p);
+end:
+    Py_XDECREF(p);
+    Py_XDECREF(m);
+    return (__Pyx_RefNannyAPIStruct *)r;
+}
+#endif
+
+/* PyObjectGetAttrStr */
+#if CYTHON_USE_TYPE_SLOTS
+static CYTHON_INLINE PyObject* __Pyx_PyObject_GetAttrStr(PyObject* obj, PyObject* attr_name) {
+    PyTypeObject* tp = Py_TYPE(obj);
+    if (likely(tp->tp_getattro))
+        return tp->tp_getattro(obj, attr_name);
+#if PY_MAJOR_VERSION < 3
+    if (likely(tp->tp_getattr))
+        return tp->tp_getattr(obj, PyString_AS_STRING(attr_name));
+#endif
+    return PyObject_GetAttr(obj, attr_name);
+}
+#endif
+
+/* GetBuiltinName */
+static PyObject *__Pyx_GetBuiltinName(PyObject *name) {
+    PyObject* result = __Pyx_PyObject_GetAttrStr(__pyx_b, name);
+    if (unlikely(!result)) {
+        PyErr_Format(PyExc_NameError,
+#if PY_MAJOR_VERSION >= 3
+            "name '%U' is not defined", name);
+#else
+            "name '%.200s' is not defined", PyString_AS_STRING(name));
+#endif
+    }
+    return result;
+}
+
+/* ExtTypeTest */
+static CYTHON_INLINE int __Pyx_TypeTest(PyObject *obj, PyTypeObject *type) {
+    if (unlikely(!type)) {
+        PyErr_SetString(PyExc_SystemError, "Missing type object");
+        return 0;
+    }
+    if (likely(__Pyx_TypeCheck(obj, type)))
+        return 1;
+    PyErr_Format(PyExc_TypeError, "Cannot convert %.200s to %.200s",
+                 Py_TYPE(obj)->tp_name, type->tp_name);
+    return 0;
+}
+
+/* IsLittleEndian */
+static CYTHON_INLINE int __Pyx_Is_Little_Endian(void)
+{
+  union {
+    uint32_t u32;
+    uint8_t u8[4];
+  } S;
+  S.u32 = 0x01020304;
+  return S.u8[0] == 4;
+}
+
+/* BufferFormatCheck */
+static void __Pyx_BufFmt_Init(__Pyx_BufFmt_Context* ctx,
+                              __Pyx_BufFmt_StackElem* stack,
+                              __Pyx_TypeInfo* type) {
+  stack[0].field = &ctx->root;
+  stack[0].parent_offset = 0;
+  ctx->root.type = type;
+  ctx->root.name = "buffer dtype";
+  ctx->root.offset = 0;
+  ctx->head = stack;
+  ctx->head->field = &ctx->root;
+  ctx->fmt_offset = 0;
+  ctx->head->parent_offset = 0;
+  ctx->new_packmode = '@';
+  ctx->enc_packmode = '@';
+  ctx->new_count = 1;
+  ctx->enc_count = 0;
+  ctx->enc_type = 0;
+  ctx->is_complex = 0;
+  ctx->is_valid_array = 0;
+  ctx->struct_alignment = 0;
+  while (type->typegroup == 'S') {
+    ++ctx->head;
+    ctx->head->field = type->fields;
+    ctx->head->parent_offset = 0;
+    type = type->fields->type;
+  }
+}
+static int __Pyx_BufFmt_ParseNumber(const char** ts) {
+    int count;
+    const char* t = *ts;
+    if (*t < '0' || *t > '9') {
+      return -1;
+    } else {
+        count = *t++ - '0';
+        while (*t >= '0' && *t <= '9') {
+            count *= 10;
+            count += *t++ - '0';
+        }
+    }
+    *ts = t;
+    return count;
+}
+static int __Pyx_BufFmt_ExpectNumber(const char **ts) {
+    int number = __Pyx_BufFmt_ParseNumber(ts);
+    if (number == -1)
+        PyErr_Format(PyExc_ValueError,\
+                     "Does not understand character buffer dtype format string ('%c')", **ts);
+    return number;
+}
+static void __Pyx_BufFmt_RaiseUnexpectedChar(char ch) {
+  PyErr_Format(PyExc_ValueError,
+               "Unexpected format string character: '%c'", ch);
+}
+static const char* __Pyx_BufFmt_DescribeTypeChar(char ch, int is_complex) {
+  switch (ch) {
+    case '?': return "'bool'";
+    case 'c': return "'char'";
+    case 'b': return "'signed char'";
+    case 'B': return "'unsigned char'";
+    case 'h': return "'short'";
+    case 'H': return "'unsigned short'";
+    case 'i': return "'int'";
+    case 'I': return "'unsigned int'";
+    case 'l': return "'long'";
+    case 'L': return "'unsigned long'";
+    case 'q': return "'long long'";
+    case 'Q': return "'unsigned long long'";
+    case 'f': return (is_complex ? "'complex float'" : "'float'");
+    case 'd': return (is_complex ? "'complex double'" : "'double'");
+    case 'g': return (is_complex ? "'complex long double'" : "'long double'");
+    case 'T': return "a struct";
+    case 'O': return "Python object";
+    case 'P': return "a pointer";
+    case 's': case 'p': return "a string";
+    case 0: return "end";
+    default: return "unparseable format string";
+  }
+}
+static size_t __Pyx_BufFmt_TypeCharToStandardSize(char ch, int is_complex) {
+  switch (ch) {
+    case '?': case 'c': case 'b': case 'B': case 's': case 'p': return 1;
+    case 'h': case 'H': return 2;
+    case 'i': case 'I': case 'l': case 'L': return 4;
+    case 'q': case 'Q': return 8;
+    case 'f': return (is_complex ? 8 : 4);
+    case 'd': return (is_complex ? 16 : 8);
+    case 'g': {
+      PyErr_SetString(PyExc_ValueError, "Python does not define a standard format string size for long double ('g')..");
+      return 0;
+    }
+    case 'O': case 'P': return sizeof(void*);
+    default:
+      __Pyx_BufFmt_RaiseUnexpectedChar(ch);
+      return 0;
+    }
+}
+static size_t __Pyx_BufFmt_TypeCharToNativeSize(char ch, int is_complex) {
+  switch (ch) {
+    case '?': case 'c': case 'b': case 'B': case 's': case 'p': return 1;
+    case 'h': case 'H': return sizeof(short);
+    case 'i': case 'I': return sizeof(int);
+    case 'l': case 'L': return sizeof(long);
+    #ifdef HAVE_LONG_LONG
+    case 'q': case 'Q': return sizeof(PY_LONG_LONG);
+    #endif
+    case 'f': return sizeof(float) * (is_complex ? 2 : 1);
+    case 'd': return sizeof(double) * (is_complex ? 2 : 1);
+    case 'g': return sizeof(long double) * (is_complex ? 2 : 1);
+    case 'O': case 'P': return sizeof(void*);
+    default: {
+      __Pyx_BufFmt_RaiseUnexpectedChar(ch);
+      return 0;
+    }
+  }
+}
+typedef struct { char c; short x; } __Pyx_st_short;
+typedef struct { char c; int x; } __Pyx_st_int;
+typedef struct { char c; long x; } __Pyx_st_long;
+typedef struct { char c; float x; } __Pyx_st_float;
+typedef struct { char c; double x; } __Pyx_st_double;
+typedef struct { char c; long double x; } __Pyx_st_longdouble;
+typedef struct { char c; void *x; } __Pyx_st_void_p;
+#ifdef HAVE_LONG_LONG
+typedef struct { char c; PY_LONG_LONG x; } __Pyx_st_longlong;
+#endif
+static size_t __Pyx_BufFmt_TypeCharToAlignment(char ch, CYTHON_UNUSED int is_complex) {
+  switch (ch) {
+    case '?': case 'c': case 'b': case 'B': case 's': case 'p': return 1;
+    case 'h': case 'H': return sizeof(__Pyx_st_short) - sizeof(short);
+    case 'i': case 'I': return sizeof(__Pyx_st_int) - sizeof(int);
+    case 'l': case 'L': return sizeof(__Pyx_st_long) - sizeof(long);
+#ifdef HAVE_LONG_LONG
+    case 'q': case 'Q': return sizeof(__Pyx_st_longlong) - sizeof(PY_LONG_LONG);
+#endif
+    case 'f': return sizeof(__Pyx_st_float) - sizeof(float);
+    case 'd': return sizeof(__Pyx_st_double) - sizeof(double);
+    case 'g': return sizeof(__Pyx_st_longdouble) - sizeof(long double);
+    case 'P': case 'O': return sizeof(__Pyx_st_void_p) - sizeof(void*);
+    default:
+      __Pyx_BufFmt_RaiseUnexpectedChar(ch);
+      return 0;
+    }
+}
+/* These are for computing the padding at the end of the struct to align
+   on the first member of the struct. This will probably the same as above,
+   but we don't have any guarantees.
+ */
+typedef struct { short x; char c; } __Pyx_pad_short;
+typedef struct { int x; char c; } __Pyx_pad_int;
+typedef struct { long x; char c; } __Pyx_pad_long;
+typedef struct { float x; char c; } __Pyx_pad_float;
+typedef struct { double x; char c; } __Pyx_pad_double;
+typedef struct { long double x; char c; } __Pyx_pad_longdouble;
+typedef struct { void *x; char c; } __Pyx_pad_void_p;
+#ifdef HAVE_LONG_LONG
+typedef struct { PY_LONG_LONG x; char c; } __Pyx_pad_longlong;
+#endif
+static size_t __Pyx_BufFmt_TypeCharToPadding(char ch, CYTHON_UNUSED int is_complex) {
+  switch (ch) {
+    case '?': case 'c': case 'b': case 'B': case 's': case 'p': return 1;
+    case 'h': case 'H': return sizeof(__Pyx_pad_short) - sizeof(short);
+    case 'i': case 'I': return sizeof(__Pyx_pad_int) - sizeof(int);
+    case 'l': case 'L': return sizeof(__Pyx_pad_long) - sizeof(long);
+#ifdef HAVE_LONG_LONG
+    case 'q': case 'Q': return sizeof(__Pyx_pad_longlong) - sizeof(PY_LONG_LONG);
+#endif
+    case 'f': return sizeof(__Pyx_pad_float) - sizeof(float);
+    case 'd': return sizeof(__Pyx_pad_double) - sizeof(double);
+    case 'g': return sizeof(__Pyx_pad_longdouble) - sizeof(long double);
+    case 'P': case 'O': return sizeof(__Pyx_pad_void_p) - sizeof(void*);
+    default:
+      __Pyx_BufFmt_RaiseUnexpectedChar(ch);
+      return 0;
+    }
+}
+static char __Pyx_BufFmt_TypeCharToGroup(char ch, int is_complex) {
+  switch (ch) {
+    case 'c':
+        return 'H';
+    case 'b': case 'h': case 'i':
+    case 'l': case 'q': case 's': case 'p':
+        return 'I';
+    case '?': case 'B': case 'H': case 'I': case 'L': case 'Q':
+        return 'U';
+    case 'f': case 'd': case 'g':
+        return (is_complex ? 'C' : 'R');
+    case 'O':
+        return 'O';
+    case 'P':
+        return 'P';
+    default: {
+      __Pyx_BufFmt_RaiseUnexpectedChar(ch);
+      return 0;
+    }
+  }
+}
+static void __Pyx_BufFmt_RaiseExpected(__Pyx_BufFmt_Context* ctx) {
+  if (ctx->head == NULL || ctx->head->field == &ctx->root) {
+    const char* expected;
+    const char* quote;
+    if (ctx->head == NULL) {
+      expected = "end";
+      quote = "";
+    } else {
+      expected = ctx->head->field->type->name;
+      quote = "'";
+    }
+    PyErr_Format(PyExc_ValueError,
+                 "Buffer dtype mismatch, expected %s%s%s but got %s",
+                 quote, expected, quote,
+                 __Pyx_BufFmt_DescribeTypeChar(ctx->enc_type, ctx->is_complex));
+  } else {
+    __Pyx_StructField* field = ctx->head->field;
+    __Pyx_StructField* parent = (ctx->head - 1)->field;
+    PyErr_Format(PyExc_ValueError,
+                 "Buffer dtype mismatch, expected '%s' but got %s in '%s.%s'",
+                 field->type->name, __Pyx_BufFmt_DescribeTypeChar(ctx->enc_type, ctx->is_complex),
+                 parent->type->name, field->name);
+  }
+}
+static int __Pyx_BufFmt_ProcessTypeChunk(__Pyx_BufFmt_Context* ctx) {
+  char group;
+  size_t size, offset, arraysize = 1;
+  if (ctx->enc_type == 0) return 0;
+  if (ctx->head->field->type->arraysize[0]) {
+    int i, ndim = 0;
+    if (ctx->enc_type == 's' || ctx->enc_type == 'p') {
+        ctx->is_valid_array = ctx->head->field->type->ndim == 1;
+        ndim = 1;
+        if (ctx->enc_count != ctx->head->field->type->arraysize[0]) {
+            PyErr_Format(PyExc_ValueError,
+                         "Expected a dimension of size %zu, got %zu",
+                         ctx->head->field->type->arraysize[0], ctx->enc_count);
+            return -1;
+        }
+    }
+    if (!ctx->is_valid_array) {
+      PyErr_Format(PyExc_ValueError, "Expected %d dimensions, got %d",
+                   ctx->head->field->type->ndim, ndim);
+      return -1;
+    }
+    for (i = 0; i < ctx->head->field->type->ndim; i++) {
+      arraysize *= ctx->head->field->type->arraysize[i];
+    }
+    ctx->is_valid_array = 0;
+    ctx->enc_count = 1;
+  }
+  group = __Pyx_BufFmt_TypeCharToGroup(ctx->enc_type, ctx->is_complex);
+  do {
+    __Pyx_StructField* field = ctx->head->field;
+    __Pyx_TypeInfo* type = field->type;
+    if (ctx->enc_packmode == '@' || ctx->enc_packmode == '^') {
+      size = __Pyx_BufFmt_TypeCharToNativeSize(ctx->enc_type, ctx->is_complex);
+    } else {
+      size = __Pyx_BufFmt_TypeCharToStandardSize(ctx->enc_type, ctx->is_complex);
+    }
+    if (ctx->enc_packmode == '@') {
+      size_t align_at = __Pyx_BufFmt_TypeCharToAlignment(ctx->enc_type, ctx->is_complex);
+      size_t align_mod_offset;
+      if (align_at == 0) return -1;
+      align_mod_offset = ctx->fmt_offset % align_at;
+      if (align_mod_offset > 0) ctx->fmt_offset += align_at - align_mod_offset;
+      if (ctx->struct_alignment == 0)
+          ctx->struct_alignment = __Pyx_BufFmt_TypeCharToPadding(ctx->enc_type,
+                                                                 ctx->is_complex);
+    }
+    if (type->size != size || type->typegroup != group) {
+      if (type->typegroup == 'C' && type->fields != NULL) {
+        size_t parent_offset = ctx->head->parent_offset + field->offset;
+        ++ctx->head;
+        ctx->head->field = type->fields;
+        ctx->head->parent_offset = parent_offset;
+        continue;
+      }
+      if ((type->typegroup == 'H' || group == 'H') && type->size == size) {
+      } else {
+          __Pyx_BufFmt_RaiseExpected(ctx);
+          return -1;
+      }
+    }
+    offset = ctx->head->parent_offset + field->offset;
+    if (ctx->fmt_offset != offset) {
+      PyErr_Format(PyExc_ValueError,
+                   "Buffer dtype mismatch; next field is at offset %" CYTHON_FORMAT_SSIZE_T "d but %" CYTHON_FORMAT_SSIZE_T "d expected",
+                   (Py_ssize_t)ctx->fmt_offset, (Py_ssize_t)offset);
+      return -1;
+    }
+    ctx->fmt_offset += size;
+    if (arraysize)
+      ctx->fmt_offset += (arraysize - 1) * size;
+    --ctx->enc_count;
+    while (1) {
+      if (field == &ctx->root) {
+        ctx->head = NULL;
+        if (ctx->enc_count != 0) {
+          __Pyx_BufFmt_RaiseExpected(ctx);
+          return -1;
+        }
+        break;
+      }
+      ctx->head->field = ++field;
+      if (field->type == NULL) {
+        --ctx->head;
+        field = ctx->head->field;
+        continue;
+      } else if (field->type->typegroup == 'S') {
+        size_t parent_offset = ctx->head->parent_offset + field->offset;
+        if (field->type->fields->type == NULL) continue;
+        field = field->type->fields;
+        ++ctx->head;
+        ctx->head->field = field;
+        ctx->head->parent_offset = parent_offset;
+        break;
+      } else {
+        break;
+      }
+    }
+  } while (ctx->enc_count);
+  ctx->enc_type = 0;
+  ctx->is_complex = 0;
+  return 0;
+}
+static PyObject *
+__pyx_buffmt_parse_array(__Pyx_BufFmt_Context* ctx, const char** tsp)
+{
+    const char *ts = *tsp;
+    int i = 0, number, ndim;
+    ++ts;
+    if (ctx->new_count != 1) {
+        PyErr_SetString(PyExc_ValueError,
+                        "Cannot handle repeated arrays in format string");
+        return NULL;
+    }
+    if (__Pyx_BufFmt_ProcessTypeChunk(ctx) == -1) return NULL;
+    ndim = ctx->head->field->type->ndim;
+    while (*ts && *ts != ')') {
+        switch (*ts) {
+            case ' ': case '\f': case '\r': case '\n': case '\t': case '\v':  continue;
+            default:  break;
+        }
+        number = __Pyx_BufFmt_ExpectNumber(&ts);
+        if (number == -1) return NULL;
+        if (i < ndim && (size_t) number != ctx->head->field->type->arraysize[i])
+            return PyErr_Format(PyExc_ValueError,
+                        "Expected a dimension of size %zu, got %d",
+                        ctx->head->field->type->arraysize[i], number);
+        if (*ts != ',' && *ts != ')')
+            return PyErr_Format(PyExc_ValueError,
+                                "Expected a comma in format string, got '%c'", *ts);
+        if (*ts == ',') ts++;
+        i++;
+    }
+    if (i != ndim)
+        return PyErr_Format(PyExc_ValueError, "Expected %d dimension(s), got %d",
+                            ctx->head->field->type->ndim, i);
+    if (!*ts) {
+        PyErr_SetString(PyExc_ValueError,
+                        "Unexpected end of format string, expected ')'");
+        return NULL;
+    }
+    ctx->is_valid_array = 1;
+    ctx->new_count = 1;
+    *tsp = ++ts;
+    return Py_None;
+}
+static const char* __Pyx_BufFmt_CheckString(__Pyx_BufFmt_Context* ctx, const char* ts) {
+  int got_Z = 0;
+  while (1) {
+    switch(*ts) {
+      case 0:
+        if (ctx->enc_type != 0 && ctx->head == NULL) {
+          __Pyx_BufFmt_RaiseExpected(ctx);
+          return NULL;
+        }
+        if (__Pyx_BufFmt_ProcessTypeChunk(ctx) == -1) return NULL;
+        if (ctx->head != NULL) {
+          __Pyx_BufFmt_RaiseExpected(ctx);
+          return NULL;
+        }
+        return ts;
+      case ' ':
+      case '\r':
+      case '\n':
+        ++ts;
+        break;
+      case '<':
+        if (!__Pyx_Is_Little_Endian()) {
+          PyErr_SetString(PyExc_ValueError, "Little-endian buffer not supported on big-endian compiler");
+          return NULL;
+        }
+        ctx->new_packmode = '=';
+        ++ts;
+        break;
+      case '>':
+      case '!':
+        if (__Pyx_Is_Little_Endian()) {
+          PyErr_SetString(PyExc_ValueError, "Big-endian buffer not supported on little-endian compiler");
+          return NULL;
+        }
+        ctx->new_packmode = '=';
+        ++ts;
+        break;
+      case '=':
+      case '@':
+      case '^':
+        ctx->new_packmode = *ts++;
+        break;
+      case 'T':
+        {
+          const char* ts_after_sub;
+          size_t i, struct_count = ctx->new_count;
+          size_t struct_alignment = ctx->struct_alignment;
+          ctx->new_count = 1;
+          ++ts;
+          if (*ts != '{') {
+            PyErr_SetString(PyExc_ValueError, "Buffer acquisition: Expected '{' after 'T'");
+            return NULL;
+          }
+          if (__Pyx_BufFmt_ProcessTypeChunk(ctx) == -1) return NULL;
+          ctx->enc_type = 0;
+          ctx->enc_count = 0;
+          ctx->struct_alignment = 0;
+          ++ts;
+          ts_after_sub = ts;
+          for (i = 0; i != struct_count; ++i) {
+            ts_after_sub = __Pyx_BufFmt_CheckString(ctx, ts);
+            if (!ts_after_sub) return NULL;
+          }
+          ts = ts_after_sub;
+          if (struct_alignment) ctx->struct_alignment = struct_alignment;
+        }
+        break;
+      case '}':
+        {
+          size_t alignment = ctx->struct_alignment;
+          ++ts;
+          if (__Pyx_BufFmt_ProcessTypeChunk(ctx) == -1) return NULL;
+          ctx->enc_type = 0;
+          if (alignment && ctx->fmt_offset % alignment) {
+            ctx->fmt_offset += alignment - (ctx->fmt_offset % alignment);
+          }
+        }
+        return ts;
+      case 'x':
+        if (__Pyx_BufFmt_ProcessTypeChunk(ctx) == -1) return NULL;
+        ctx->fmt_offset += ctx->new_count;
+        ctx->new_count = 1;
+        ctx->enc_count = 0;
+        ctx->enc_type = 0;
+        ctx->enc_packmode = ctx->new_packmode;
+        ++ts;
+        break;
+      case 'Z':
+        got_Z = 1;
+        ++ts;
+        if (*ts != 'f' && *ts != 'd' && *ts != 'g') {
+          __Pyx_BufFmt_RaiseUnexpectedChar('Z');
+          return NULL;
+        }
+        CYTHON_FALLTHROUGH;
+      case '?': case 'c': case 'b': case 'B': case 'h': case 'H': case 'i': case 'I':
+      case 'l': case 'L': case 'q': case 'Q':
+      case 'f': case 'd': case 'g':
+      case 'O': case 'p':
+        if ((ctx->enc_type == *ts) && (got_Z == ctx->is_complex) &&
+            (ctx->enc_packmode == ctx->new_packmode) && (!ctx->is_valid_array)) {
+          ctx->enc_count += ctx->new_count;
+          ctx->new_count = 1;
+          got_Z = 0;
+          ++ts;
+          break;
+        }
+        CYTHON_FALLTHROUGH;
+      case 's':
+        if (__Pyx_BufFmt_ProcessTypeChunk(ctx) == -1) return NULL;
+        ctx->enc_count = ctx->new_count;
+        ctx->enc_packmode = ctx->new_packmode;
+        ctx->enc_type = *ts;
+        ctx->is_complex = got_Z;
+        ++ts;
+        ctx->new_count = 1;
+        got_Z = 0;
+        break;
+      case ':':
+        ++ts;
+        while(*ts != ':') ++ts;
+        ++ts;
+        break;
+      case '(':
+        if (!__pyx_buffmt_parse_array(ctx, &ts)) return NULL;
+        break;
+      default:
+        {
+          int number = __Pyx_BufFmt_ExpectNumber(&ts);
+          if (number == -1) return NULL;
+          ctx->new_count = (size_t)number;
+        }
+    }
+  }
+}
+
+/* BufferGetAndValidate */
+  static CYTHON_INLINE void __Pyx_SafeReleaseBuffer(Py_buffer* info) {
+  if (unlikely(info->buf == NULL)) return;
+  if (info->suboffsets == __Pyx_minusones) info->suboffsets = NULL;
+  __Pyx_ReleaseBuffer(info);
+}
+static void __Pyx_ZeroBuffer(Py_buffer* buf) {
+  buf->buf = NULL;
+  buf->obj = NULL;
+  buf->strides = __Pyx_zeros;
+  buf->shape = __Pyx_zeros;
+  buf->suboffsets = __Pyx_minusones;
+}
+static int __Pyx__GetBufferAndValidate(
+        Py_buffer* buf, PyObject* obj,  __Pyx_TypeInfo* dtype, int flags,
+        int nd, int cast, __Pyx_BufFmt_StackElem* stack)
+{
+  buf->buf = NULL;
+  if (unlikely(__Pyx_GetBuffer(obj, buf, flags) == -1)) {
+    __Pyx_ZeroBuffer(buf);
+    return -1;
+  }
+  if (unlikely(buf->ndim != nd)) {
+    PyErr_Format(PyExc_ValueError,
+                 "Buffer has wrong number of dimensions (expected %d, got %d)",
+                 nd, buf->ndim);
+    goto fail;
+  }
+  if (!cast) {
+    __Pyx_BufFmt_Context ctx;
+    __Pyx_BufFmt_Init(&ctx, stack, dtype);
+    if (!__Pyx_BufFmt_CheckString(&ctx, buf->format)) goto fail;
+  }
+  if (unlikely((size_t)buf->itemsize != dtype->size)) {
+    PyErr_Format(PyExc_ValueError,
+      "Item size of buffer (%" CYTHON_FORMAT_SSIZE_T "d byte%s) does not match size of '%s' (%" CYTHON_FORMAT_SSIZE_T "d byte%s)",
+      buf->itemsize, (buf->itemsize > 1) ? "s" : "",
+      dtype->name, (Py_ssize_t)dtype->size, (dtype->size > 1) ? "s" : "");
+    goto fail;
+  }
+  if (buf->suboffsets == NULL) buf->suboffsets = __Pyx_minusones;
+  return 0;
+fail:;
+  __Pyx_SafeReleaseBuffer(buf);
+  return -1;
+}
+
+/* PyDictVersioning */
+  #if CYTHON_USE_DICT_VERSIONS && CYTHON_USE_TYPE_SLOTS
+static CYTHON_INLINE PY_UINT64_T __Pyx_get_tp_dict_version(PyObject *obj) {
+    PyObject *dict = Py_TYPE(obj)->tp_dict;
+    return likely(dict) ? __PYX_GET_DICT_VERSION(dict) : 0;
+}
+static CYTHON_INLINE PY_UINT64_T __Pyx_get_object_dict_version(PyObject *obj) {
+    PyObject **dictptr = NULL;
+    Py_ssize_t offset = Py_TYPE(obj)->tp_dictoffset;
+    if (offset) {
+#if CYTHON_COMPILING_IN_CPYTHON
+        dictptr = (likely(offset > 0)) ? (PyObject **) ((char *)obj + offset) : _PyObject_GetDictPtr(obj);
+#else
+        dictptr = _PyObject_GetDictPtr(obj);
+#endif
+    }
+    return (dictptr && *dictptr) ? __PYX_GET_DICT_VERSION(*dictptr) : 0;
+}
+static CYTHON_INLINE int __Pyx_object_dict_version_matches(PyObject* obj, PY_UINT64_T tp_dict_version, PY_UINT64_T obj_dict_version) {
+    PyObject *dict = Py_TYPE(obj)->tp_dict;
+    if (unlikely(!dict) || unlikely(tp_dict_version != __PYX_GET_DICT_VERSION(dict)))
+        return 0;
+    return obj_dict_version == __Pyx_get_object_dict_version(obj);
+}
+#endif
+
+/* GetModuleGlobalName */
+  #if CYTHON_USE_DICT_VERSIONS
+static PyObject *__Pyx__GetModuleGlobalName(PyObject *name, PY_UINT64_T *dict_version, PyObject **dict_cached_value)
+#else
+static CYTHON_INLINE PyObject *__Pyx__GetModuleGlobalName(PyObject *name)
+#endif
+{
+    PyObject *result;
+#if !CYTHON_AVOID_BORROWED_REFS
+#if CYTHON_COMPILING_IN_CPYTHON && PY_VERSION_HEX >= 0x030500A1
+    result = _PyDict_GetItem_KnownHash(__pyx_d, name, ((PyASCIIObject *) name)->hash);
+    __PYX_UPDATE_DICT_CACHE(__pyx_d, result, *dict_cached_value, *dict_version)
+    if (likely(result)) {
+        return __Pyx_NewRef(result);
+    } else if (unlikely(PyErr_Occurred())) {
+        return NULL;
+    }
+#else
+    result = PyDict_GetItem(__pyx_d, name);
+    __PYX_UPDATE_DICT_CACHE(__pyx_d, result, *dict_cached_value, *dict_version)
+    if (likely(result)) {
+        return __Pyx_NewRef(result);
+    }
+#endif
+#else
+    result = PyObject_GetItem(__pyx_d, name);
+    __PYX_UPDATE_DICT_CACHE(__pyx_d, result, *dict_cached_value, *dict_version)
+    if (likely(result)) {
+        return __Pyx_NewRef(result);
+    }
+    PyErr_Clear();
+#endif
+    return __Pyx_GetBuiltinName(name);
+}
+
+/* PyObjectCall */
+  #if CYTHON_COMPILING_IN_CPYTHON
+static CYTHON_INLINE PyObject* __Pyx_PyObject_Call(PyObject *func, PyObject *arg, PyObject *kw) {
+    PyObject *result;
+    ternaryfunc call = Py_TYPE(func)->tp_call;
+    if (unlikely(!call))
+        return PyObject_Call(func, arg, kw);
+    if (unlikely(Py_EnterRecursiveCall((char*)" while calling a Python object")))
+        return NULL;
+    result = (*call)(func, arg, kw);
+    Py_LeaveRecursiveCall();
+    if (unlikely(!result) && unlikely(!PyErr_Occurred())) {
+        PyErr_SetString(
+            PyExc_SystemError,
+            "NULL result without error in PyObject_Call");
+    }
+    return result;
+}
+#endif
+
+/* PyObjectSetAttrStr */
+  #if CYTHON_USE_TYPE_SLOTS
+static CYTHON_INLINE int __Pyx_PyObject_SetAttrStr(PyObject* obj, PyObject* attr_name, PyObject* value) {
+    PyTypeObject* tp = Py_TYPE(obj);
+    if (likely(tp->tp_setattro))
+        return tp->tp_setattro(obj, attr_name, value);
+#if PY_MAJOR_VERSION < 3
+    if (likely(tp->tp_setattr))
+        return tp->tp_setattr(obj, PyString_AS_STRING(attr_name), value);
+#endif
+    return PyObject_SetAttr(obj, attr_name, value);
+}
+#endif
+
+/* GetItemInt */
+  static PyObject *__Pyx_GetItemInt_Generic(PyObject *o, PyObject* j) {
+    PyObject *r;
+    if (!j) return NULL;
+    r = PyObject_GetItem(o, j);
+    Py_DECREF(j);
+    return r;
+}
+static CYTHON_INLINE PyObject *__Pyx_GetItemInt_List_Fast(PyObject *o, Py_ssize_t i,
+                                                              CYTHON_NCP_UNUSED int wraparound,
+                                                              CYTHON_NCP_UNUSED int boundscheck) {
+#if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+    Py_ssize_t wrapped_i = i;
+    if (wraparound & unlikely(i < 0)) {
+        wrapped_i += PyList_GET_SIZE(o);
+    }
+    if ((!boundscheck) || likely(__Pyx_is_valid_index(wrapped_i, PyList_GET_SIZE(o)))) {
+        PyObject *r = PyList_GET_ITEM(o, wrapped_i);
+        Py_INCREF(r);
+        return r;
+    }
+    return __Pyx_GetItemInt_Generic(o, PyInt_FromSsize_t(i));
+#else
+    return PySequence_GetItem(o, i);
+#endif
+}
+static CYTHON_INLINE PyObject *__Pyx_GetItemInt_Tuple_Fast(PyObject *o, Py_ssize_t i,
+                                                              CYTHON_NCP_UNUSED int wraparound,
+                                                              CYTHON_NCP_UNUSED int boundscheck) {
+#if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS
+    Py_ssize_t wrapped_i = i;
+    if (wraparound & unlikely(i < 0)) {
+        wrapped_i += PyTuple_GET_SIZE(o);
+    }
+    if ((!boundscheck) || likely(__Pyx_is_valid_index(wrapped_i, PyTuple_GET_SIZE(o)))) {
+        PyObject *r = PyTuple_GET_ITEM(o, wrapped_i);
+        Py_INCREF(r);
+        return r;
+    }
+    return __Pyx_GetItemInt_Generic(o, PyInt_FromSsize_t(i));
+#else
+    return PySequence_GetItem(o, i);
+#endif
+}
+static CYTHON_INLINE PyObject *__Pyx_GetItemInt_Fast(PyObject *o, Py_ssize_t i, int is_list,
+                                                     CYTHON_NCP_UNUSED int wraparound,
+                                                     CYTHON_NCP_UNUSED int boundscheck) {
+#if CYTHON_ASSUME_SAFE_MACROS && !CYTHON_AVOID_BORROWED_REFS && CYTHON_USE_TYPE_SLOTS
+    if (is_list || PyList_CheckExact(o)) {
+        Py_ssize_t n = ((!wraparound) | likely(i >= 0)) ? i : i + PyList_GET_SIZE(o);
+        if ((!boundscheck) || (likely(__Pyx_is_valid_index(n, PyList_GET_SIZE(o))))) {
+            PyObject *r = PyList_GET_ITEM(o, n);
+            Py_INCREF(r);
+            return r;
+        }
+    }
+    else if (PyTuple_CheckExact(o)) {
+        Py_ssize_t n = ((!wraparound) | likely(i >= 0)) ? i : i + PyTuple_GET_SIZE(o);
+        if ((!boundscheck) || likely(__Pyx_is_valid_index(n, PyTuple_GET_SIZE(o)))) {
+            PyObject *r = PyTuple_GET_ITEM(o, n);
+            Py_INCREF(r);
+            return r;
+        }
+    } else {
+        PySequenceMethods *m = Py_TYPE(o)->tp_as_sequence;
+        if (likely(m && m->sq_item)) {
+            if (wraparound && unlikely(i < 0) && likely(m->sq_length)) {
+                Py_ssize_t l = m->sq_length(o);
+                if (likely(l >= 0)) {
+                    i += l;
+                } else {
+                    if (!PyErr_ExceptionMatches(PyExc_OverflowError))
+                        return NULL;
+                    PyErr_Clear();
+                }
+            }
+            return m->sq_item(o, i);
+        }
+    }
+#else
+    if (is_list || PySequence_Check(o)) {
+        return PySequence_GetItem(o, i);
+    }
+#endif
+    return __Pyx_GetItemInt_Generic(o, PyInt_FromSsize_t(i));
+}
+
+/* ObjectGetItem */
+  #if CYTHON_USE_TYPE_SLOTS
+static PyObject *__Pyx_PyObject_GetIndex(PyObject *obj, PyObject* index) {
+    PyObject *runerr = NULL;
+    Py_ssize_t key_value;
+    PySequenceMethods *m = Py_TYPE(obj)->tp_as_sequence;
+    if (unlikely(!(m && m->sq_item))) {
+        PyErr_Format(PyExc_TypeError, "'%.200s' object is not subscriptable", Py_TYPE(obj)->tp_name);
+        return NULL;
+    }
+    key_value = __Pyx_PyIndex_AsSsize_t(index);
+    if (likely(key_value != -1 || !(runerr = PyErr_Occurred()))) {
+        return __Pyx_GetItemInt_Fast(obj, key_value, 0, 1, 1);
+    }
+    if (PyErr_GivenExceptionMatches(runerr, PyExc_OverflowError)) {
+        PyErr_Clear();
+        PyErr_Format(PyExc_IndexError, "cannot fit '%.200s' into an index-sized integer", Py_TYPE(index)->tp_name);
+    }
+    return NULL;
+}
+static PyObject *__Pyx_PyObject_GetItem(PyObject *obj, PyObject* key) {
+    PyMappingMethods *m = Py_TYPE(obj)->tp_as_mapping;
+    if (likely(m && m->mp_subscript)) {
+        return m->mp_subscript(obj, key);
+    }
+    return __Pyx_PyObject_GetIndex(obj, key);
+}
+#endif
+
+/* PyFunctionFastCall */
+  #if CYTHON_FAST_PYCALL
+static PyObject* __Pyx_PyFunction_FastCallNoKw(PyCodeObject *co, PyObject **args, Py_ssize_t na,
+                                               PyObject *globals) {
+    PyFrameObject *f;
+    PyThreadState *tstate = __Pyx_PyThreadState_Current;
+    PyObject **fastlocals;
+    Py_ssize_t i;
+    PyObject *result;
+    assert(globals != NULL);
+    /* XXX Perhaps we should create a specialized
+       PyFrame_New() that doesn't take locals, but does
+       take builtins without sanity checking them.
+       */
+    assert(tstate != NULL);
+    f = PyFrame_New(tstate, co, globals, NULL);
+    if (f == NULL) {
+        return NULL;
+    }
+    fastlocals = __Pyx_PyFrame_GetLocalsplus(f);
+    for (i = 0; i < na; i++) {
+        Py_INCREF(*args);
+        fastlocals[i] = *args++;
+    }
+    result = PyEval_EvalFrameEx(f,0);
+    ++tstate->recursion_depth;
+    Py_DECREF(f);
+    --tstate->recursion_depth;
+    return result;
+}
+#if 1 || PY_VERSION_HEX < 0x030600B1
+static PyObject *__Pyx_PyFunction_FastCallDict(PyObject *func, PyObject **args, Py_ssize_t nargs, PyObject *kwargs) {
+    PyCodeObject *co = (PyCodeObject *)PyFunction_GET_CODE(func);
+    PyObject *globals = PyFunction_GET_GLOBALS(func);
+    PyObject *argdefs = PyFunction_GET_DEFAULTS(func);
+    PyObject *closure;
+#if PY_MAJOR_VERSION >= 3
+    PyObject *kwdefs;
+#endif
+    PyObject *kwtuple, **k;
+    PyObject **d;
+    Py_ssize_t nd;
+    Py_ssize_t nk;
+    PyObject *result;
+    assert(kwargs == NULL || PyDict_Check(kwargs));
+    nk = kwargs ? PyDict_Size(kwargs) : 0;
+    if (Py_EnterRecursiveCall((char*)" while calling a Python object")) {
+        return NULL;
+    }
+    if (
+#if PY_MAJOR_VERSION >= 3
+            co->co_kwonlyargcount == 0 &&
+#endif
+            likely(kwargs == NULL || nk == 0) &&
+            co->co_flags == (CO_OPTIMIZED | CO_NEWLOCALS | CO_NOFREE)) {
+        if (argdefs == NULL && co->co_argcount == nargs) {
+            result = __Pyx_PyFunction_FastCallNoKw(co, args, nargs, globals);
+            goto done;
+        }
+        else if (nargs == 0 && argdefs != NULL
+                 && co->co_argcount == Py_SIZE(argdefs)) {
+            /* function called with no arguments, but all parameters have
+               a default value: use default values as arguments .*/
+            args = &PyTuple_GET_ITEM(argdefs, 0);
+            result =__Pyx_PyFunction_FastCallNoKw(co, args, Py_SIZE(argdefs), globals);
+            goto done;
+        }
+    }
+    if (kwargs != NULL) {
+        Py_ssize_t pos, i;
+        kwtuple = PyTuple_New(2 * nk);
+        if (kwtuple == NULL) {
+            result = NULL;
+            goto done;
+        }
+        k = &PyTuple_GET_ITEM(kwtuple, 0);
+        pos = i = 0;
+        while (PyDict_Next(kwargs, &pos, &k[i], &k[i+1])) {
+            Py_INCREF(k[i]);
+            Py_INCREF(k[i+1]);
+            i += 2;
+        }
+        nk = i / 2;
+    }
+    else {
+        kwtuple = NULL;
+        k = NULL;
+    }
+    closure = PyFunction_GET_CLOSURE(func);
+#if PY_MAJOR_VERSION >= 3
+    kwdefs = PyFunction_GET_KW_DEFAULTS(func);
+#endif
+    if (argdefs != NULL) {
+        d = &PyTuple_GET_ITEM(argdefs, 0);
+        nd = Py_SIZE(argdefs);
+    }
+    else {
+        d = NULL;
+        nd = 0;
+    }
+#if PY_MAJOR_VERSION >= 3
+    result = PyEval_EvalCodeEx((PyObject*)co, globals, (PyObject *)NULL,
+                               args, (int)nargs,
+                               k, (int)nk,
+                               d, (int)nd, kwdefs, closure);
+#else
+    result = PyEval_EvalCodeEx(co, globals, (PyObject *)NULL,
+                               args, (int)nargs,
+                               k, (int)nk,
+                               d, (int)nd, closure);
+#endif
+    Py_XDECREF(kwtuple);
+done:
+    Py_LeaveRecursiveCall();
+    return result;
+}
+#endif
+#endif
+
+/* PyCFunctionFastCall */
+  #if CYTHON_FAST_PYCCALL
+static CYTHON_INLINE PyObject * __Pyx_PyCFunction_FastCall(PyObject *func_obj, PyObject **args, Py_ssize_t nargs) {
+    PyCFunctionObject *func = (PyCFunctionObject*)func_obj;
+    PyCFunction meth = PyCFunction_GET_FUNCTION(func);
+    PyObject *self = PyCFunction_GET_SELF(func);
+    int flags = PyCFunction_GET_FLAGS(func);
+    assert(PyCFunction_Check(func));
+    assert(METH_FASTCALL == (flags & ~(METH_CLASS | METH_STATIC | METH_COEXIST | METH_KEYWORDS | METH_STACKLESS)));
+    assert(nargs >= 0);
+    assert(nargs == 0 || args != NULL);
+    /* _PyCFunction_FastCallDict() must not be called with an exception set,
+       because it may clear it (directly or indirectly) and so the
+       caller loses its exception */
+    assert(!PyErr_Occurred());
+    if ((PY_VERSION_HEX < 0x030700A0) || unlikely(flags & METH_KEYWORDS)) {
+        return (*((__Pyx_PyCFunctionFastWithKeywords)(void*)meth)) (self, args, nargs, NULL);
+    } else {
+        return (*((__Pyx_PyCFunctionFast)(void*)meth)) (self, args, nargs);
+    }
+}
+#endif
+
+/* RaiseTooManyValuesToUnpack */
+  static CYTHON_INLINE void __Pyx_RaiseTooManyValuesError(Py_ssize_t expected) {
+    PyErr_Format(PyExc_ValueError,
+                 "too many values to unpack (expected %" CYTHON_FORMAT_SSIZE_T "d)", expected);
+}
+
+/* RaiseNeedMoreValuesToUnpack */
+  static CYTHON_INLINE void __Pyx_RaiseNeedMoreValuesError(Py_ssize_t index) {
+    PyErr_Format(PyExc_ValueError,
+                 "need more than %" CYTHON_FORMAT_SSIZE_T "d value%.1s to unpack",
+                 index, (index == 1) ? "" : "s");
+}
+
+/* IterFinish */
+  static CYTHON_INLINE int __Pyx_IterFinish(void) {
+#if CYTHON_FAST_THREAD_STATE
+    PyThreadState *tstate = __Pyx_PyThreadState_Current;
+    PyObject* exc_type = tstate->curexc_type;
+    if (unlikely(exc_type)) {
+        if (likely(__Pyx_PyErr_GivenExceptionMatches(exc_type, PyExc_StopIteration))) {
+            PyObject *exc_value, *exc_tb;
+            exc_value = tstate->curexc_value;
+            exc_tb = tstate->curexc_traceback;
+            tstate->curexc_type = 0;
+            tstate->curexc_value = 0;
+            tstate->curexc_traceback = 0;
+            Py_DECREF(exc_type);
+            Py_XDECREF(exc_value);
+            Py_XDECREF(exc_tb);
+            return 0;
+        } else {
+            return -1;
+        }
+    }
+    return 0;
+#else
+    if (unlikely(PyErr_Occurred())) {
+        if (likely(PyErr_ExceptionMatches(PyExc_StopIteration))) {
+            PyErr_Clear();
+            return 0;
+        } else {
+            return -1;
+        }
+    }
+    return 0;
+#endif
+}
+
+/* UnpackItemEndCheck */
+  static int __Pyx_IternextUnpackEndCheck(PyObject *retval, Py_ssize_t expected) {
+    if (unlikely(retval)) {
+        Py_DECREF(retval);
+        __Pyx_RaiseTooManyValuesError(expected);
+        return -1;
+    }
+    return __Pyx_IterFinish();
+}
+
+/* PyErrFetchRestore */
+  #if CYTHON_FAST_THREAD_STATE
+static CYTHON_INLINE void __Pyx_ErrRestoreInState(PyThreadState *tstate, PyObject *type, PyObject *value, PyObject *tb) {
+    PyObject *tmp_type, *tmp_value, *tmp_tb;
+    tmp_type = tstate->curexc_type;
+    tmp_value = tstate->curexc_value;
+    tmp_tb = tstate->curexc_traceback;
+    tstate->curexc_type = type;
+    tstate->curexc_value = value;
+    tstate->curexc_traceback = tb;
+    Py_XDECREF(tmp_type);
+    Py_XDECREF(tmp_value);
+    Py_XDECREF(tmp_tb);
+}
+static CYTHON_INLINE void __Pyx_ErrFetchInState(PyThreadState *tstate, PyObject **type, PyObject **value, PyObject **tb) {
+    *type = tstate->curexc_type;
+    *value = tstate->curexc_value;
+    *tb = tstate->curexc_traceback;
+    tstate->curexc_type = 0;
+    tstate->curexc_value = 0;
+    tstate->curexc_traceback = 0;
+}
+#endif
+
+/* GetTopmostException */
+  #if CYTHON_USE_EXC_INFO_STACK
+static _PyErr_StackItem *
+__Pyx_PyErr_GetTopmostException(PyThreadState *tstate)
+{
+    _PyErr_StackItem *exc_info = tstate->exc_info;
+    while ((exc_info->exc_type == NULL || exc_info->exc_type == Py_None) &&
+           exc_info->previous_item != NULL)
+    {
+        exc_info = exc_info->previous_item;
+    }
+    return exc_info;
+}
+#endif
+
+/* SaveResetException */
+  #if CYTHON_FAST_THREAD_STATE
+static CYTHON_INLINE void __Pyx__ExceptionSave(PyThreadState *tstate, PyObject **type, PyObject **value, PyObject **tb) {
+    #if CYTHON_USE_EXC_INFO_STACK
+    _PyErr_StackItem *exc_info = __Pyx_PyErr_GetTopmostException(tstate);
+    *type = exc_info->exc_type;
+    *value = exc_info->exc_value;
+    *tb = exc_info->exc_traceback;
+    #else
+    *type = tstate->exc_type;
+    *value = tstate->exc_value;
+    *tb = tstate->exc_traceback;
+    #endif
+    Py_XINCREF(*type);
+    Py_XINCREF(*value);
+    Py_XINCREF(*tb);
+}
+static CYTHON_INLINE void __Pyx__ExceptionReset(PyThreadState *tstate, PyObject *type, PyObject *value, PyObject *tb) {
+    PyObject *tmp_type, *tmp_value, *tmp_tb;
+    #if CYTHON_USE_EXC_INFO_STACK
+    _PyErr_StackItem *exc_info = tstate->exc_info;
+    tmp_type = exc_info->exc_type;
+    tmp_value = exc_info->exc_value;
+    tmp_tb = exc_info->exc_traceback;
+    exc_info->exc_type = type;
+    exc_info->exc_value = value;
+    exc_info->exc_traceback = tb;
+    #else
+    tmp_type = tstate->exc_type;
+    tmp_value = tstate->exc_value;
+    tmp_tb = tstate->exc_traceback;
+    tstate->exc_type = type;
+    tstate->exc_value = value;
+    tstate->exc_traceback = tb;
+    #endif
+    Py_XDECREF(tmp_type);
+    Py_XDECREF(tmp_value);
+    Py_XDECREF(tmp_tb);
+}
+#endif
+
+/* PyErrExceptionMatches */
+  #if CYTHON_FAST_THREAD_STATE
+static int __Pyx_PyErr_ExceptionMatchesTuple(PyObject *exc_type, PyObject *tuple) {
+    Py_ssize_t i, n;
+    n = PyTuple_GET_SIZE(tuple);
+#if PY_MAJOR_VERSION >= 3
+    for (i=0; i<n; i++) {
+        if (exc_type == PyTuple_GET_ITEM(tuple, i)) return 1;
+    }
+#endif
+    for (i=0; i<n; i++) {
+        if (__Pyx_PyErr_GivenExceptionMatches(exc_type, PyTuple_GET_ITEM(tuple, i))) return 1;
+    }
+    return 0;
+}
+static CYTHON_INLINE int __Pyx_PyErr_ExceptionMatchesInState(PyThreadState* tstate, PyObject* err) {
+    PyObject *exc_type = tstate->curexc_type;
+    if (exc_type == err) return 1;
+    if (unlikely(!exc_type)) return 0;
+    if (unlikely(PyTuple_Check(err)))
+        return __Pyx_PyErr_ExceptionMatchesTuple(exc_type, err);
+    return __Pyx_PyErr_GivenExceptionMatches(exc_type, err);
+}
+#endif
+
+/* GetException */
+  #if CYTHON_FAST_THREAD_STATE
+static int __Pyx__GetException(PyThreadState *tstate, PyObject **type, PyObject **value, PyObject **tb)
+#else
+static int __Pyx_GetException(PyObject **type, PyObject **value, PyObject **tb)
+#endif
+{
+    PyObject *local_type, *local_value, *local_tb;
+#if CYTHON_FAST_THREAD_STATE
+    PyObject *tmp_type, *tmp_value, *tmp_tb;
+    local_type = tstate->curexc_type;
+    local_value = tstate->curexc_value;
+    local_tb = tstate->curexc_traceback;
+    tstate->curexc_type = 0;
+    tstate->curexc_value = 0;
+    tstate->curexc_traceback = 0;
+#else
+    PyErr_Fetch(&local_type, &local_value, &local_tb);
+#endif
+    PyErr_NormalizeException(&local_type, &local_value, &local_tb);
+#if CYTHON_FAST_THREAD_STATE
+    if (unlikely(tstate->curexc_type))
+#else
+    if (unlikely(PyErr_Occurred()))
+#endif
+        goto bad;
+    #if PY_MAJOR_VERSION >= 3
+    if (local_tb) {
+        if (unlikely(PyException_SetTraceback(local_value, local_tb) < 0))
+            goto bad;
+    }
+    #endif
+    Py_XINCREF(local_tb);
+    Py_XINCREF(local_type);
+    Py_XINCREF(local_value);
+    *type = local_type;
+    *value = local_value;
+    *tb = local_tb;
+#if CYTHON_FAST_THREAD_STATE
+    #if CYTHON_USE_EXC_INFO_STACK
+    {
+        _PyErr_StackItem *exc_info = tstate->exc_info;
+        tmp_type = exc_info->exc_type;
+        tmp_value = exc_info->exc_value;
+        tmp_tb = exc_info->exc_traceback;
+        exc_info->exc_type = local_type;
+        exc_info->exc_value = local_value;
+        exc_info->exc_traceback = local_tb;
+    }
+    #else
+    tmp_type = tstate->exc_type;
+    tmp_value = tstate->exc_value;
+    tmp_tb = tstate->exc_traceback;
+    tstate->exc_type = local_type;
+    tstate->exc_value = local_value;
+    tstate->exc_traceback = local_tb;
+    #endif
+    Py_XDECREF(tmp_type);
+    Py_XDECREF(tmp_value);
+    Py_XDECREF(tmp_tb);
+#else
+    PyErr_SetExcInfo(local_type, local_value, local_tb);
+#endif
+    return 0;
+bad:
+    *type = 0;
+    *value = 0;
+    *tb = 0;
+    Py_XDECREF(local_type);
+    Py_XDECREF(local_value);
+    Py_XDECREF(local_tb);
+    return -1;
+}
+
+/* RaiseException */
+  #if PY_MAJOR_VERSION < 3
+static void __Pyx_Raise(PyObject *type, PyObject *value, PyObject *tb,
+                        CYTHON_UNUSED PyObject *cause) {
+    __Pyx_PyThreadState_declare
+    Py_XINCREF(type);
+    if (!value || value == Py_None)
+        value = NULL;
+    else
+        Py_INCREF(value);
+    if (!tb || tb == Py_None)
+        tb = NULL;
+    else {
+        Py_INCREF(tb);
+        if (!PyTraceBack_Check(tb)) {
+            PyErr_SetString(PyExc_TypeError,
+                "raise: arg 3 must be a traceback or None");
+            goto raise_error;
+        }
+    }
+    if (PyType_Check(type)) {
+#if CYTHON_COMPILING_IN_PYPY
+        if (!value) {
+            Py_INCREF(Py_None);
+            value = Py_None;
+        }
+#endif
+        PyErr_NormalizeException(&type, &value, &tb);
+    } else {
+        if (value) {
+            PyErr_SetString(PyExc_TypeError,
+                "instance exception may not have a separate value");
+            goto raise_error;
+        }
+        value = type;
+        type = (PyObject*) Py_TYPE(type);
+        Py_INCREF(type);
+        if (!PyType_IsSubtype((PyTypeObject *)type, (PyTypeObject *)PyExc_BaseException)) {
+            PyErr_SetString(PyExc_TypeError,
+                "raise: exception class must be a subclass of BaseException");
+            goto raise_error;
+        }
+    }
+    __Pyx_PyThreadState_assign
+    __Pyx_ErrRestore(type, value, tb);
+    return;
+raise_error:
+    Py_XDECREF(value);
+    Py_XDECREF(type);
+    Py_XDECREF(tb);
+    return;
+}
+#else
+static void __Pyx_Raise(PyObject *type, PyObject *value, PyObject *tb, PyObject *cause) {
+    PyObject* owned_instance = NULL;
+    if (tb == Py_None) {
+        tb = 0;
+    } else if (tb && !PyTraceBack_Check(tb)) {
+        PyErr_SetString(PyExc_TypeError,
+            "raise: arg 3 must be a traceback or None");
+        goto bad;
+    }
+    if (value == Py_None)
+        value = 0;
+    if (PyExceptionInstance_Check(type)) {
+        if (value) {
+            PyErr_SetString(PyExc_TypeError,
+                "instance exception may not have a separate value");
+            goto bad;
+        }
+        value = type;
+        type = (PyObject*) Py_TYPE(value);
+    } else if (PyExceptionClass_Check(type)) {
+        PyObject *instance_class = NULL;
+        if (value && PyExceptionInstance_Check(value)) {
+            instance_class = (PyObject*) Py_TYPE(value);
+            if (instance_class != type) {
+                int is_subclass = PyObject_IsSubclass(instance_class, type);
+                if (!is_subclass) {
+                    instance_class = NULL;
+                } else if (unlikely(is_subclass == -1)) {
+                    goto bad;
+                } else {
+                    type = instance_class;
+                }
+            }
+        }
+        if (!instance_class) {
+            PyObject *args;
+            if (!value)
+                args = PyTuple_New(0);
+            else if (PyTuple_Check(value)) {
+                Py_INCREF(value);
+                args = value;
+            } else
+                args = PyTuple_Pack(1, value);
+            if (!args)
+                goto bad;
+            owned_instance = PyObject_Call(type, args, NULL);
+            Py_DECREF(args);
+            if (!owned_instance)
+                goto bad;
+            value = owned_instance;
+            if (!PyExceptionInstance_Check(value)) {
+                PyErr_Format(PyExc_TypeError,
+                             "calling %R should have returned an instance of "
+                             "BaseException, not %R",
+                             type, Py_TYPE(value));
+                goto bad;
+            }
+        }
+    } else {
+        PyErr_SetString(PyExc_TypeError,
+            "raise: exception class must be a subclass of BaseException");
+        goto bad;
+    }
+    if (cause) {
+        PyObject *fixed_cause;
+        if (cause == Py_None) {
+            fixed_cause = NULL;
+        } else if (PyExceptionClass_Check(cause)) {
+            fixed_cause = PyObject_CallObject(cause, NULL);
+            if (fixed_cause == NULL)
+                goto bad;
+        } else if (PyExceptionInstance_Check(cause)) {
+            fixed_cause = cause;
+            Py_INCREF(fixed_cause);
+        } else {
+            PyErr_SetString(PyExc_TypeError,
+                            "exception causes must derive from "
+                            "BaseException");
+            goto bad;
+        }
+        PyException_SetCause(value, fixed_cause);
+    }
+    PyErr_SetObject(type, value);
+    if (tb) {
+#if CYTHON_FAST_THREAD_STATE
+        PyThreadState *tstate = __Pyx_PyThreadState_Current;
+        PyObject* tmp_tb = tstate->curexc_traceback;
+        if (tb != tmp_tb) {
+            Py_INCREF(tb);
+            tstate->curexc_traceback = tb;
+            Py_XDECREF(tmp_tb);
+        }
+#else
+        PyObject *tmp_type, *tmp_value, *tmp_tb;
+        PyErr_Fetch(&tmp_type, &tmp_value, &tmp_tb);
+        Py_INCREF(tb);
+        PyErr_Restore(tmp_type, tmp_value, tb);
+        Py_XDECREF(tmp_tb);
+#endif
+    }
+bad:
+    Py_XDECREF(owned_instance);
+    return;
+}
+#endif
+
+/* TypeImport */
+  #ifndef __PYX_HAVE_RT_ImportType_0_29_37
+#define __PYX_HAVE_RT_ImportType_0_29_37
+static PyTypeObject *__Pyx_ImportType_0_29_37(PyObject *module, const char *module_name, const char *class_name,
+    size_t size, size_t alignment, enum __Pyx_ImportType_CheckSize_0_29_37 check_size)
+{
+    PyObject *result = 0;
+    char warning[200];
+    Py_ssize_t basicsize;
+    Py_ssize_t itemsize;
+#ifdef Py_LIMITED_API
+    PyObject *py_basicsize;
+    PyObject *py_itemsize;
+#endif
+    result = PyObject_GetAttrString(module, class_name);
+    if (!result)
+        goto bad;
+    if (!PyType_Check(result)) {
+        PyErr_Format(PyExc_TypeError,
+            "%.200s.%.200s is not a type object",
+            module_name, class_name);
+        goto bad;
+    }
+#ifndef Py_LIMITED_API
+    basicsize = ((PyTypeObject *)result)->tp_basicsize;
+    itemsize = ((PyTypeObject *)result)->tp_itemsize;
+#else
+    py_basicsize = PyObject_GetAttrString(result, "__basicsize__");
+    if (!py_basicsize)
+        goto bad;
+    basicsize = PyLong_AsSsize_t(py_basicsize);
+    Py_DECREF(py_basicsize);
+    py_basicsize = 0;
+    if (basicsize == (Py_ssize_t)-1 && PyErr_Occurred())
+        goto bad;
+    py_itemsize = PyObject_GetAttrString(result, "__itemsize__");
+    if (!py_itemsize)
+        goto bad;
+    itemsize = PyLong_AsSsize_t(py_itemsize);
+    Py_DECREF(py_itemsize);
+    py_itemsize = 0;
+    if (itemsize == (Py_ssize_t)-1 && PyErr_Occurred())
+        goto bad;
+#endif
+    if (itemsize) {
+        if (size % alignment) {
+            alignment = size % alignment;
+        }
+        if (itemsize < (Py_ssize_t)alignment)
+            itemsize = (Py_ssize_t)alignment;
+    }
+    if ((size_t)(basicsize + itemsize) < size) {
+        PyErr_Format(PyExc_ValueError,
+            "%.200s.%.200s size changed, may indicate binary incompatibility. "
+            "Expected %zd from C header, got %zd from PyObject",
+            module_name, class_name, size, basicsize);
+        goto bad;
+    }
+    if (check_size == __Pyx_ImportType_CheckSize_Error_0_29_37 && (size_t)basicsize != size) {
+        PyErr_Format(PyExc_ValueError,
+            "%.200s.%.200s size changed, may indicate binary incompatibility. "
+            "Expected %zd from C header, got %zd from PyObject",
+            module_name, class_name, size, basicsize);
+        goto bad;
+    }
+    else if (check_size == __Pyx_ImportType_CheckSize_Warn_0_29_37 && (size_t)basicsize > size) {
+        PyOS_snprintf(warning, sizeof(warning),
+            "%s.%s size changed, may indicate binary incompatibility. "
+            "Expected %zd from C header, got %zd from PyObject",
+            module_name, class_name, size, basicsize);
+        if (PyErr_WarnEx(NULL, warning, 0) < 0) goto bad;
+    }
+    return (PyTypeObject *)result;
+bad:
+    Py_XDECREF(result);
+    return NULL;
+}
+#endif
+
+/* Import */
+  static PyObject *__Pyx_Import(PyObject *name, PyObject *from_list, int level) {
+    PyObject *empty_list = 0;
+    PyObject *module = 0;
+    PyObject *global_dict = 0;
+    PyObject *empty_dict = 0;
+    PyObject *list;
+    #if PY_MAJOR_VERSION < 3
+    PyObject *py_import;
+    py_import = __Pyx_PyObject_GetAttrStr(__pyx_b, __pyx_n_s_import);
+    if (!py_import)
+        goto bad;
+    #endif
+    if (from_list)
+        list = from_list;
+    else {
+        empty_list = PyList_New(0);
+        if (!empty_list)
+            goto bad;
+        list = empty_list;
+    }
+    global_dict = PyModule_GetDict(__pyx_m);
+    if (!global_dict)
+        goto bad;
+    empty_dict = PyDict_New();
+    if (!empty_dict)
+        goto bad;
+    {
+        #if PY_MAJOR_VERSION >= 3
+        if (level == -1) {
+            if ((1) && (strchr(__Pyx_MODULE_NAME, '.'))) {
+                module = PyImport_ImportModuleLevelObject(
+                    name, global_dict, empty_dict, list, 1);
+                if (!module) {
+                    if (!PyErr_ExceptionMatches(PyExc_ImportError))
+                        goto bad;
+                    PyErr_Clear();
+                }
+            }
+            level = 0;
+        }
+        #endif
+        if (!module) {
+            #if PY_MAJOR_VERSION < 3
+            PyObject *py_level = PyInt_FromLong(level);
+            if (!py_level)
+                goto bad;
+            module = PyObject_CallFunctionObjArgs(py_import,
+                name, global_dict, empty_dict, list, py_level, (PyObject *)NULL);
+            Py_DECREF(py_level);
+            #else
+            module = PyImport_ImportModuleLevelObject(
+                name, global_dict, empty_dict, list, level);
+            #endif
+        }
+    }
+bad:
+    #if PY_MAJOR_VERSION < 3
+    Py_XDECREF(py_import);
+    #endif
+    Py_XDECREF(empty_list);
+    Py_XDECREF(empty_dict);
+    return module;
+}
+
+/* ImportFrom */
+  static PyObject* __Pyx_ImportFrom(PyObject* module, PyObject* name) {
+    PyObject* value = __Pyx_PyObject_GetAttrStr(module, name);
+    if (unlikely(!value) && PyErr_ExceptionMatches(PyExc_AttributeError)) {
+        PyErr_Format(PyExc_ImportError,
+        #if PY_MAJOR_VERSION < 3
+            "cannot import name %.230s", PyString_AS_STRING(name));
+        #else
+            "cannot import name %S", name);
+        #endif
+    }
+    return value;
+}
+
+/* CalculateMetaclass */
+  static PyObject *__Pyx_CalculateMetaclass(PyTypeObject *metaclass, PyObject *bases) {
+    Py_ssize_t i, nbases = PyTuple_GET_SIZE(bases);
+    for (i=0; i < nbases; i++) {
+        PyTypeObject *tmptype;
+        PyObject *tmp = PyTuple_GET_ITEM(bases, i);
+        tmptype = Py_TYPE(tmp);
+#if PY_MAJOR_VERSION < 3
+        if (tmptype == &PyClass_Type)
+            continue;
+#endif
+        if (!metaclass) {
+            metaclass = tmptype;
+            continue;
+        }
+        if (PyType_IsSubtype(metaclass, tmptype))
+            continue;
+        if (PyType_IsSubtype(tmptype, metaclass)) {
+            metaclass = tmptype;
+            continue;
+        }
+        PyErr_SetString(PyExc_TypeError,
+                        "metaclass conflict: "
+                        "the metaclass of a derived class "
+                        "must be a (non-strict) subclass "
+                        "of the metaclasses of all its bases");
+        return NULL;
+    }
+    if (!metaclass) {
+#if PY_MAJOR_VERSION < 3
+        metaclass = &PyClass_Type;
+#else
+        metaclass = &PyType_Type;
+#endif
+    }
+    Py_INCREF((PyObject*) metaclass);
+    return (PyObject*) metaclass;
+}
+
+/* Py3ClassCreate */
+  static PyObject *__Pyx_Py3MetaclassPrepare(PyObject *metaclass, PyObject *bases, PyObject *name,
+                                           PyObject *qualname, PyObject *mkw, PyObject *modname, PyObject *doc) {
+    PyObject *ns;
+    if (metaclass) {
+        PyObject *prep = __Pyx_PyObject_GetAttrStr(metaclass, __pyx_n_s_prepare);
+        if (prep) {
+            PyObject *pargs = PyTuple_Pack(2, name, bases);
+            if (unlikely(!pargs)) {
+                Py_DECREF(prep);
+                return NULL;
+            }
+            ns = PyObject_Call(prep, pargs, mkw);
+            Py_DECREF(prep);
+            Py_DECREF(pargs);
+        } else {
+            if (unlikely(!PyErr_ExceptionMatches(PyExc_AttributeError)))
+                return NULL;
+            PyErr_Clear();
+            ns = PyDict_New();
+        }
+    } else {
+        ns = PyDict_New();
+    }
+    if (unlikely(!ns))
+        return NULL;
+    if (unlikely(PyObject_SetItem(ns, __pyx_n_s_module, modname) < 0)) goto bad;
+    if (unlikely(PyObject_SetItem(ns, __pyx_n_s_qualname, qualname) < 0)) goto bad;
+    if (unlikely(doc && PyObject_SetItem(ns, __pyx_n_s_doc, doc) < 0)) goto bad;
+    return ns;
+bad:
+    Py_DECREF(ns);
+    return NULL;
+}
+static PyObject *__Pyx_Py3ClassCreate(PyObject *metaclass, PyObject *name, PyObject *bases,
+                                      PyObject *dict, PyObject *mkw,
+                                      int calculate_metaclass, int allow_py2_metaclass) {
+    PyObject *result, *margs;
+    PyObject *owned_metaclass = NULL;
+    if (allow_py2_metaclass) {
+        owned_metaclass = PyObject_GetItem(dict, __pyx_n_s_metaclass);
+        if (owned_metaclass) {
+            metaclass = owned_metaclass;
+        } else if (likely(PyErr_ExceptionMatches(PyExc_KeyError))) {
+            PyErr_Clear();
+        } else {
+            return NULL;
+        }
+    }
+    if (calculate_metaclass && (!metaclass || PyType_Check(metaclass))) {
+        metaclass = __Pyx_CalculateMetaclass((PyTypeObject*) metaclass, bases);
+        Py_XDECREF(owned_metaclass);
+        if (unlikely(!metaclass))
+            return NULL;
+        owned_metaclass = metaclass;
+    }
+    margs = PyTuple_Pack(3, name, bases, dict);
+    if (unlikely(!margs)) {
+        result = NULL;
+    } else {
+        result = PyObject_Call(metaclass, margs, mkw);
+        Py_DECREF(margs);
+    }
+    Py_XDECREF(owned_metaclass);
+    return result;
+}
+
+/* CLineInTraceback */
+  #ifndef CYTHON_CLINE_IN_TRACEBACK
+static int __Pyx_CLineForTraceback(CYTHON_UNUSED PyThreadState *tstate, int c_line) {
+    PyObject *use_cline;
+    PyObject *ptype, *pvalue, *ptraceback;
+#if CYTHON_COMPILING_IN_CPYTHON
+    PyObject **cython_runtime_dict;
+#endif
+    if (unlikely(!__pyx_cython_runtime)) {
+        return c_line;
+    }
+    __Pyx_ErrFetchInState(tstate, &ptype, &pvalue, &ptraceback);
+#if CYTHON_COMPILING_IN_CPYTHON
+    cython_runtime_dict = _PyObject_GetDictPtr(__pyx_cython_runtime);
+    if (likely(cython_runtime_dict)) {
+        __PYX_PY_DICT_LOOKUP_IF_MODIFIED(
+            use_cline, *cython_runtime_dict,
+            __Pyx_PyDict_GetItemStr(*cython_runtime_dict, __pyx_n_s_cline_in_traceback))
+    } else
+#endif
+    {
+      PyObject *use_cline_obj = __Pyx_PyObject_GetAttrStr(__pyx_cython_runtime, __pyx_n_s_cline_in_traceback);
+      if (use_cline_obj) {
+        use_cline = PyObject_Not(use_cline_obj) ? Py_False : Py_True;
+        Py_DECREF(use_cline_obj);
+      } else {
+        PyErr_Clear();
+        use_cline = NULL;
+      }
+    }
+    if (!use_cline) {
+        c_line = 0;
+        (void) PyObject_SetAttr(__pyx_cython_runtime, __pyx_n_s_cline_in_traceback, Py_False);
+    }
+    else if (use_cline == Py_False || (use_cline != Py_True && PyObject_Not(use_cline) != 0)) {
+        c_line = 0;
+    }
+    __Pyx_ErrRestoreInState(tstate, ptype, pvalue, ptraceback);
+    return c_line;
+}
+#endif
+
+/* CodeObjectCache */
+  static int __pyx_bisect_code_objects(__Pyx_CodeObjectCacheEntry* entries, int count, int code_line) {
+    int start = 0, mid = 0, end = count - 1;
+    if (end >= 0 && code_line > entries[end].code_line) {
+        return count;
+    }
+    while (start < end) {
+        mid = start + (end - start) / 2;
+        if (code_line < entries[mid].code_line) {
+            end = mid;
+        } else if (code_line > entries[mid].code_line) {
+             start = mid + 1;
+        } else {
+            return mid;
+        }
+    }
+    if (code_line <= entries[mid].code_line) {
+        return mid;
+    } else {
+        return mid + 1;
+    }
+}
+static PyCodeObject *__pyx_find_code_object(int code_line) {
+    PyCodeObject* code_object;
+    int pos;
+    if (unlikely(!code_line) || unlikely(!__pyx_code_cache.entries)) {
+        return NULL;
+    }
+    pos = __pyx_bisect_code_objects(__pyx_code_cache.entries, __pyx_code_cache.count, code_line);
+    if (unlikely(pos >= __pyx_code_cache.count) || unlikely(__pyx_code_cache.entries[pos].code_line != code_line)) {
+        return NULL;
+    }
+    code_object = __pyx_code_cache.entries[pos].code_object;
+    Py_INCREF(code_object);
+    return code_object;
+}
+static void __pyx_insert_code_object(int code_line, PyCodeObject* code_object) {
+    int pos, i;
+    __Pyx_CodeObjectCacheEntry* entries = __pyx_code_cache.entries;
+    if (unlikely(!code_line)) {
+        return;
+    }
+    if (unlikely(!entries)) {
+        entries = (__Pyx_CodeObjectCacheEntry*)PyMem_Malloc(64*sizeof(__Pyx_CodeObjectCacheEntry));
+        if (likely(entries)) {
+            __pyx_code_cache.entries = entries;
+            __pyx_code_cache.max_count = 64;
+            __pyx_code_cache.count = 1;
+            entries[0].code_line = code_line;
+            entries[0].code_object = code_object;
+            Py_INCREF(code_object);
+        }
+        return;
+    }
+    pos = __pyx_bisect_code_objects(__pyx_code_cache.entries, __pyx_code_cache.count, code_line);
+    if ((pos < __pyx_code_cache.count) && unlikely(__pyx_code_cache.entries[pos].code_line == code_line)) {
+        PyCodeObject* tmp = entries[pos].code_object;
+        entries[pos].code_object = code_object;
+        Py_DECREF(tmp);
+        return;
+    }
+    if (__pyx_code_cache.count == __pyx_code_cache.max_count) {
+        int new_max = __pyx_code_cache.max_count + 64;
+        entries = (__Pyx_CodeObjectCacheEntry*)PyMem_Realloc(
+            __pyx_code_cache.entries, ((size_t)new_max) * sizeof(__Pyx_CodeObjectCacheEntry));
+        if (unlikely(!entries)) {
+            return;
+        }
+        __pyx_code_cache.entries = entries;
+        __pyx_code_cache.max_count = new_max;
+    }
+    for (i=__pyx_code_cache.count; i>pos; i--) {
+        entries[i] = entries[i-1];
+    }
+    entries[pos].code_line = code_line;
+    entries[pos].code_object = code_object;
+    __pyx_code_cache.count++;
+    Py_INCREF(code_object);
+}
+
+/* AddTraceback */
+  #include "compile.h"
+#include "frameobject.h"
+#include "traceback.h"
+#if PY_VERSION_HEX >= 0x030b00a6
+  #ifndef Py_BUILD_CORE
+    #define Py_BUILD_CORE 1
+  #endif
+  #include "internal/pycore_frame.h"
+#endif
+static PyCodeObject* __Pyx_CreateCodeObjectForTraceback(
+            const char *funcname, int c_line,
+            int py_line, const char *filename) {
+    PyCodeObject *py_code = NULL;
+    PyObject *py_funcname = NULL;
+    #if PY_MAJOR_VERSION < 3
+    PyObject *py_srcfile = NULL;
+    py_srcfile = PyString_FromString(filename);
+    if (!py_srcfile) goto bad;
+    #endif
+    if (c_line) {
+        #if PY_MAJOR_VERSION < 3
+        py_funcname = PyString_FromFormat( "%s (%s:%d)", funcname, __pyx_cfilenm, c_line);
+        if (!py_funcname) goto bad;
+        #else
+        py_funcname = PyUnicode_FromFormat( "%s (%s:%d)", funcname, __pyx_cfilenm, c_line);
+        if (!py_funcname) goto bad;
+        funcname = PyUnicode_AsUTF8(py_funcname);
+        if (!funcname) goto bad;
+        #endif
+    }
+    else {
+        #if PY_MAJOR_VERSION < 3
+        py_funcname = PyString_FromString(funcname);
+        if (!py_funcname) goto bad;
+        #endif
+    }
+    #if PY_MAJOR_VERSION < 3
+    py_code = __Pyx_PyCode_New(
+        0,
+        0,
+        0,
+        0,
+        0,
+        __pyx_empty_bytes, /*PyObject *code,*/
+        __pyx_empty_tuple, /*PyObject *consts,*/
+        __pyx_empty_tuple, /*PyObject *names,*/
+        __pyx_empty_tuple, /*PyObject *varnames,*/
+        __pyx_empty_tuple, /*PyObject *freevars,*/
+        __pyx_empty_tuple, /*PyObject *cellvars,*/
+        py_srcfile,   /*PyObject *filename,*/
+        py_funcname,  /*PyObject *name,*/
+        py_line,
+        __pyx_empty_bytes  /*PyObject *lnotab*/
+    );
+    Py_DECREF(py_srcfile);
+    #else
+    py_code = PyCode_NewEmpty(filename, funcname, py_line);
+    #endif
+    Py_XDECREF(py_funcname);  // XDECREF since it's only set on Py3 if cline
+    return py_code;
+bad:
+    Py_XDECREF(py_funcname);
+    #if PY_MAJOR_VERSION < 3
+    Py_XDECREF(py_srcfile);
+    #endif
+    return NULL;
+}
+static void __Pyx_AddTraceback(const char *funcname, int c_line,
+                               int py_line, const char *filename) {
+    PyCodeObject *py_code = 0;
+    PyFrameObject *py_frame = 0;
+    PyThreadState *tstate = __Pyx_PyThreadState_Current;
+    PyObject *ptype, *pvalue, *ptraceback;
+    if (c_line) {
+        c_line = __Pyx_CLineForTraceback(tstate, c_line);
+    }
+    py_code = __pyx_find_code_object(c_line ? -c_line : py_line);
+    if (!py_code) {
+        __Pyx_ErrFetchInState(tstate, &ptype, &pvalue, &ptraceback);
+        py_code = __Pyx_CreateCodeObjectForTraceback(
+            funcname, c_line, py_line, filename);
+        if (!py_code) {
+            /* If the code object creation fails, then we should clear the
+               fetched exception references and propagate the new exception */
+            Py_XDECREF(ptype);
+            Py_XDECREF(pvalue);
+            Py_XDECREF(ptraceback);
+            goto bad;
+        }
+        __Pyx_ErrRestoreInState(tstate, ptype, pvalue, ptraceback);
+        __pyx_insert_code_object(c_line ? -c_line : py_line, py_code);
+    }
+    py_frame = PyFrame_New(
+        tstate,            /*PyThreadState *tstate,*/
+        py_code,           /*PyCodeObject *code,*/
+        __pyx_d,    /*PyObject *globals,*/
+        0                  /*PyObject *locals*/
+    );
+    if (!py_frame) goto bad;
+    __Pyx_PyFrame_SetLineNumber(py_frame, py_line);
+    PyTraceBack_Here(py_frame);
+bad:
+    Py_XDECREF(py_code);
+    Py_XDECREF(py_frame);
+}
+
+#if PY_MAJOR_VERSION < 3
+static int __Pyx_GetBuffer(PyObject *obj, Py_buffer *view, int flags) {
+    if (PyObject_CheckBuffer(obj)) return PyObject_GetBuffer(obj, view, flags);
+    PyErr_Format(PyExc_TypeError, "'%.200s' does not have the buffer interface", Py_TYPE(obj)->tp_name);
+    return -1;
+}
+static void __Pyx_ReleaseBuffer(Py_buffer *view) {
+    PyObject *obj = view->obj;
+    if (!obj) return;
+    if (PyObject_CheckBuffer(obj)) {
+        PyBuffer_Release(view);
+        return;
+    }
+    if ((0)) {}
+    view->obj = NULL;
+    Py_DECREF(obj);
+}
+#endif
+
+
+  /* CIntFromPyVerify */
+  #define __PYX_VERIFY_RETURN_INT(target_type, func_type, func_value)\
+    __PYX__VERIFY_RETURN_INT(target_type, func_type, func_value, 0)
+#define __PYX_VERIFY_RETURN_INT_EXC(target_type, func_type, func_value)\
+    __PYX__VERIFY_RETURN_INT(target_type, func_type, func_value, 1)
+#define __PYX__VERIFY_RETURN_INT(target_type, func_type, func_value, exc)\
+    {\
+        func_type value = func_value;\
+        if (sizeof(target_type) < sizeof(func_type)) {\
+            if (unlikely(value != (func_type) (target_type) value)) {\
+                func_type zero = 0;\
+                if (exc && unlikely(value == (func_type)-1 && PyErr_Occurred()))\
+                    return (target_type) -1;\
+                if (is_unsigned && unlikely(value < zero))\
+                    goto raise_neg_overflow;\
+                else\
+                    goto raise_overflow;\
+            }\
+        }\
+        return (target_type) value;\
+    }
+
+/* Declarations */
+  #if CYTHON_CCOMPLEX
+  #ifdef __cplusplus
+    static CYTHON_INLINE __pyx_t_double_complex __pyx_t_double_complex_from_parts(double x, double y) {
+      return ::std::complex< double >(x, y);
+    }
+  #else
+    static CYTHON_INLINE __pyx_t_double_complex __pyx_t_double_complex_from_parts(double x, double y) {
+      return x + y*(__pyx_t_double_complex)_Complex_I;
+    }
+  #endif
+#else
+    static CYTHON_INLINE __pyx_t_double_complex __pyx_t_double_complex_from_parts(double x, double y) {
+      __pyx_t_double_complex z;
+      z.real = x;
+      z.imag = y;
+      return z;
+    }
+#endif
+
+/* Arithmetic */
+  #if CYTHON_CCOMPLEX
+#else
+    static CYTHON_INLINE int __Pyx_c_eq_double(__pyx_t_double_complex a, __pyx_t_double_complex b) {
+       return (a.real == b.real) && (a.imag == b.imag);
+    }
+    static CYTHON_INLINE __pyx_t_double_complex __Pyx_c_sum_double(__pyx_t_double_complex a, __pyx_t_double_complex b) {
+        __pyx_t_double_complex z;
+        z.real = a.real + b.real;
+        z.imag = a.imag + b.imag;
+        return z;
+    }
+    static CYTHON_INLINE __pyx_t_double_complex __Pyx_c_diff_double(__pyx_t_double_complex a, __pyx_t_double_complex b) {
+        __pyx_t_double_complex z;
+        z.real = a.real - b.real;
+        z.imag = a.imag - b.imag;
+        return z;
+    }
+    static CYTHON_INLINE __pyx_t_double_complex __Pyx_c_prod_double(__pyx_t_double_complex a, __pyx_t_double_complex b) {
+        __pyx_t_double_complex z;
+        z.real = a.real * b.real - a.imag * b.imag;
+        z.imag = a.real * b.imag + a.imag * b.real;
+        return z;
+    }
+    #if 1
+    static CYTHON_INLINE __pyx_t_double_complex __Pyx_c_quot_double(__pyx_t_double_complex a, __pyx_t_double_complex b) {
+        if (b.imag == 0) {
+            return __pyx_t_double_complex_from_parts(a.real / b.real, a.imag / b.real);
+        } else if (fabs(b.real) >= fabs(b.imag)) {
+            if (b.real == 0 && b.imag == 0) {
+                return __pyx_t_double_complex_from_parts(a.real / b.real, a.imag / b.imag);
+            } else {
+                double r = b.imag / b.real;
+                double s = (double)(1.0) / (b.real + b.imag * r);
+                return __pyx_t_double_complex_from_parts(
+                    (a.real + a.imag * r) * s, (a.imag - a.real * r) * s);
+            }
+        } else {
+            double r = b.real / b.imag;
+            double s = (double)(1.0) / (b.imag + b.real * r);
+            return __pyx_t_double_complex_from_parts(
+                (a.real * r + a.imag) * s, (a.imag * r - a.real) * s);
+        }
+    }
+    #else
+    static CYTHON_INLINE __pyx_t_double_complex __Pyx_c_quot_double(__pyx_t_double_complex a, __pyx_t_double_complex b) {
+        if (b.imag == 0) {
+            return __pyx_t_double_complex_from_parts(a.real / b.real, a.imag / b.real);
+        } else {
+            double denom = b.real * b.real + b.imag * b.imag;
+            return __pyx_t_double_complex_from_parts(
+                (a.real * b.real + a.imag * b.imag) / denom,
+                (a.imag * b.real - a.real * b.imag) / denom);
+        }
+    }
+    #endif
+    static CYTHON_INLINE __pyx_t_double_complex __Pyx_c_neg_double(__pyx_t_double_complex a) {
+        __pyx_t_double_complex z;
+        z.real = -a.real;
+        z.imag = -a.imag;
+        return z;
+    }
+    static CYTHON_INLINE int __Pyx_c_is_zero_double(__pyx_t_double_complex a) {
+       return (a.real == 0) && (a.imag == 0);
+    }
+    static CYTHON_INLINE __pyx_t_double_complex __Pyx_c_conj_double(__pyx_t_double_complex a) {
+        __pyx_t_double_complex z;
+        z.real =  a.real;
+        z.imag = -a.imag;
+        return z;
+    }
+    #if 1
+        static CYTHON_INLINE double __Pyx_c_abs_double(__pyx_t_double_complex z) {
+          #if !defined(HAVE_HYPOT) || defined(_MSC_VER)
+            return sqrt(z.real*z.real + z.imag*z.imag);
+          #else
+            return hypot(z.real, z.imag);
+          #endif
+        }
+        static CYTHON_INLINE __pyx_t_double_complex __Pyx_c_pow_double(__pyx_t_double_complex a, __pyx_t_double_complex b) {
+            __pyx_t_double_complex z;
+            double r, lnr, theta, z_r, z_theta;
+            if (b.imag == 0 && b.real == (int)b.real) {
+                if (b.real < 0) {
+                    double denom = a.real * a.real + a.imag * a.imag;
+                    a.real = a.real / denom;
+                    a.imag = -a.imag / denom;
+                    b.real = -b.real;
+                }
+                switch ((int)b.real) {
+                    case 0:
+                        z.real = 1;
+                        z.imag = 0;
+                        return z;
+                    case 1:
+                        return a;
+                    case 2:
+                        return __Pyx_c_prod_double(a, a);
+                    case 3:
+                        z = __Pyx_c_prod_double(a, a);
+                        return __Pyx_c_prod_double(z, a);
+                    case 4:
+                        z = __Pyx_c_prod_double(a, a);
+                        return __Pyx_c_prod_double(z, z);
+                }
+            }
+            if (a.imag == 0) {
+                if (a.real == 0) {
+                    return a;
+                } else if ((b.imag == 0) && (a.real >= 0)) {
+                    z.real = pow(a.real, b.real);
+                    z.imag = 0;
+                    return z;
+                } else if (a.real > 0) {
+                    r = a.real;
+                    theta = 0;
+                } else {
+                    r = -a.real;
+                    theta = atan2(0.0, -1.0);
+                }
+            } else {
+                r = __Pyx_c_abs_double(a);
+                theta = atan2(a.imag, a.real);
+            }
+            lnr = log(r);
+            z_r = exp(lnr * b.real - theta * b.imag);
+            z_theta = theta * b.real + lnr * b.imag;
+            z.real = z_r * cos(z_theta);
+            z.imag = z_r * sin(z_theta);
+            return z;
+        }
+    #endif
+#endif
+
+/* Declarations */
+  #if CYTHON_CCOMPLEX
+  #ifdef __cplusplus
+    static CYTHON_INLINE __pyx_t_float_complex __pyx_t_float_complex_from_parts(float x, float y) {
+      return ::std::complex< float >(x, y);
+    }
+  #else
+    static CYTHON_INLINE __pyx_t_float_complex __pyx_t_float_complex_from_parts(float x, float y) {
+      return x + y*(__pyx_t_float_complex)_Complex_I;
+    }
+  #endif
+#else
+    static CYTHON_INLINE __pyx_t_float_complex __pyx_t_float_complex_from_parts(float x, float y) {
+      __pyx_t_float_complex z;
+      z.real = x;
+      z.imag = y;
+      return z;
+    }
+#endif
+
+/* Arithmetic */
+  #if CYTHON_CCOMPLEX
+#else
+    static CYTHON_INLINE int __Pyx_c_eq_float(__pyx_t_float_complex a, __pyx_t_float_complex b) {
+       return (a.real == b.real) && (a.imag == b.imag);
+    }
+    static CYTHON_INLINE __pyx_t_float_complex __Pyx_c_sum_float(__pyx_t_float_complex a, __pyx_t_float_complex b) {
+        __pyx_t_float_complex z;
+        z.real = a.real + b.real;
+        z.imag = a.imag + b.imag;
+        return z;
+    }
+    static CYTHON_INLINE __pyx_t_float_complex __Pyx_c_diff_float(__pyx_t_float_complex a, __pyx_t_float_complex b) {
+        __pyx_t_float_complex z;
+        z.real = a.real - b.real;
+        z.imag = a.imag - b.imag;
+        return z;
+    }
+    static CYTHON_INLINE __pyx_t_float_complex __Pyx_c_prod_float(__pyx_t_float_complex a, __pyx_t_float_complex b) {
+        __pyx_t_float_complex z;
+        z.real = a.real * b.real - a.imag * b.imag;
+        z.imag = a.real * b.imag + a.imag * b.real;
+        return z;
+    }
+    #if 1
+    static CYTHON_INLINE __pyx_t_float_complex __Pyx_c_quot_float(__pyx_t_float_complex a, __pyx_t_float_complex b) {
+        if (b.imag == 0) {
+            return __pyx_t_float_complex_from_parts(a.real / b.real, a.imag / b.real);
+        } else if (fabsf(b.real) >= fabsf(b.imag)) {
+            if (b.real == 0 && b.imag == 0) {
+                return __pyx_t_float_complex_from_parts(a.real / b.real, a.imag / b.imag);
+            } else {
+                float r = b.imag / b.real;
+                float s = (float)(1.0) / (b.real + b.imag * r);
+                return __pyx_t_float_complex_from_parts(
+                    (a.real + a.imag * r) * s, (a.imag - a.real * r) * s);
+            }
+        } else {
+            float r = b.real / b.imag;
+            float s = (float)(1.0) / (b.imag + b.real * r);
+            return __pyx_t_float_complex_from_parts(
+                (a.real * r + a.imag) * s, (a.imag * r - a.real) * s);
+        }
+    }
+    #else
+    static CYTHON_INLINE __pyx_t_float_complex __Pyx_c_quot_float(__pyx_t_float_complex a, __pyx_t_float_complex b) {
+        if (b.imag == 0) {
+            return __pyx_t_float_complex_from_parts(a.real / b.real, a.imag / b.real);
+        } else {
+            float denom = b.real * b.real + b.imag * b.imag;
+            return __pyx_t_float_complex_from_parts(
+                (a.real * b.real + a.imag * b.imag) / denom,
+                (a.imag * b.real - a.real * b.imag) / denom);
+        }
+    }
+    #endif
+    static CYTHON_INLINE __pyx_t_float_complex __Pyx_c_neg_float(__pyx_t_float_complex a) {
+        __pyx_t_float_complex z;
+        z.real = -a.real;
+        z.imag = -a.imag;
+        return z;
+    }
+    static CYTHON_INLINE int __Pyx_c_is_zero_float(__pyx_t_float_complex a) {
+       return (a.real == 0) && (a.imag == 0);
+    }
+    static CYTHON_INLINE __pyx_t_float_complex __Pyx_c_conj_float(__pyx_t_float_complex a) {
+        __pyx_t_float_complex z;
+        z.real =  a.real;
+        z.imag = -a.imag;
+        return z;
+    }
+    #if 1
+        static CYTHON_INLINE float __Pyx_c_abs_float(__pyx_t_float_complex z) {
+          #if !defined(HAVE_HYPOT) || defined(_MSC_VER)
+            return sqrtf(z.real*z.real + z.imag*z.imag);
+          #else
+            return hypotf(z.real, z.imag);
+          #endif
+        }
+        static CYTHON_INLINE __pyx_t_float_complex __Pyx_c_pow_float(__pyx_t_float_complex a, __pyx_t_float_complex b) {
+            __pyx_t_float_complex z;
+            float r, lnr, theta, z_r, z_theta;
+            if (b.imag == 0 && b.real == (int)b.real) {
+                if (b.real < 0) {
+                    float denom = a.real * a.real + a.imag * a.imag;
+                    a.real = a.real / denom;
+                    a.imag = -a.imag / denom;
+                    b.real = -b.real;
+                }
+                switch ((int)b.real) {
+                    case 0:
+                        z.real = 1;
+                        z.imag = 0;
+                        return z;
+                    case 1:
+                        return a;
+                    case 2:
+                        return __Pyx_c_prod_float(a, a);
+                    case 3:
+                        z = __Pyx_c_prod_float(a, a);
+                        return __Pyx_c_prod_float(z, a);
+                    case 4:
+                        z = __Pyx_c_prod_float(a, a);
+                        return __Pyx_c_prod_float(z, z);
+                }
+            }
+            if (a.imag == 0) {
+                if (a.real == 0) {
+                    return a;
+                } else if ((b.imag == 0) && (a.real >= 0)) {
+                    z.real = powf(a.real, b.real);
+                    z.imag = 0;
+                    return z;
+                } else if (a.real > 0) {
+                    r = a.real;
+                    theta = 0;
+                } else {
+                    r = -a.real;
+                    theta = atan2f(0.0, -1.0);
+                }
+            } else {
+                r = __Pyx_c_abs_float(a);
+                theta = atan2f(a.imag, a.real);
+            }
+            lnr = logf(r);
+            z_r = expf(lnr * b.real - theta * b.imag);
+            z_theta = theta * b.real + lnr * b.imag;
+            z.real = z_r * cosf(z_theta);
+            z.imag = z_r * sinf(z_theta);
+            return z;
+        }
+    #endif
+#endif
+
+/* CIntFromPy */
+  static CYTHON_INLINE npy_int64 __Pyx_PyInt_As_npy_int64(PyObject *x) {
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic push
+#pragma GCC diagnostic ignored "-Wconversion"
+#endif
+    const npy_int64 neg_one = (npy_int64) -1, const_zero = (npy_int64) 0;
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic pop
+#endif
+    const int is_unsigned = neg_one > const_zero;
+#if PY_MAJOR_VERSION < 3
+    if (likely(PyInt_Check(x))) {
+        if (sizeof(npy_int64) < sizeof(long)) {
+            __PYX_VERIFY_RETURN_INT(npy_int64, long, PyInt_AS_LONG(x))
+        } else {
+            long val = PyInt_AS_LONG(x);
+            if (is_unsigned && unlikely(val < 0)) {
+                goto raise_neg_overflow;
+            }
+            return (npy_int64) val;
+        }
+    } else
+#endif
+    if (likely(PyLong_Check(x))) {
+        if (is_unsigned) {
+#if CYTHON_USE_PYLONG_INTERNALS
+            const digit* digits = ((PyLongObject*)x)->ob_digit;
+            switch (Py_SIZE(x)) {
+                case  0: return (npy_int64) 0;
+                case  1: __PYX_VERIFY_RETURN_INT(npy_int64, digit, digits[0])
+                case 2:
+                    if (8 * sizeof(npy_int64) > 1 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 2 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_int64, unsigned long, (((((unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_int64) >= 2 * PyLong_SHIFT) {
+                            return (npy_int64) (((((npy_int64)digits[1]) << PyLong_SHIFT) | (npy_int64)digits[0]));
+                        }
+                    }
+                    break;
+                case 3:
+                    if (8 * sizeof(npy_int64) > 2 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 3 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_int64, unsigned long, (((((((unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_int64) >= 3 * PyLong_SHIFT) {
+                            return (npy_int64) (((((((npy_int64)digits[2]) << PyLong_SHIFT) | (npy_int64)digits[1]) << PyLong_SHIFT) | (npy_int64)digits[0]));
+                        }
+                    }
+                    break;
+                case 4:
+                    if (8 * sizeof(npy_int64) > 3 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 4 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_int64, unsigned long, (((((((((unsigned long)digits[3]) << PyLong_SHIFT) | (unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_int64) >= 4 * PyLong_SHIFT) {
+                            return (npy_int64) (((((((((npy_int64)digits[3]) << PyLong_SHIFT) | (npy_int64)digits[2]) << PyLong_SHIFT) | (npy_int64)digits[1]) << PyLong_SHIFT) | (npy_int64)digits[0]));
+                        }
+                    }
+                    break;
+            }
+#endif
+#if CYTHON_COMPILING_IN_CPYTHON && PY_VERSION_HEX < 0x030C00A7
+            if (unlikely(Py_SIZE(x) < 0)) {
+                goto raise_neg_overflow;
+            }
+#else
+            {
+                int result = PyObject_RichCompareBool(x, Py_False, Py_LT);
+                if (unlikely(result < 0))
+                    return (npy_int64) -1;
+                if (unlikely(result == 1))
+                    goto raise_neg_overflow;
+            }
+#endif
+            if (sizeof(npy_int64) <= sizeof(unsigned long)) {
+                __PYX_VERIFY_RETURN_INT_EXC(npy_int64, unsigned long, PyLong_AsUnsignedLong(x))
+#ifdef HAVE_LONG_LONG
+            } else if (sizeof(npy_int64) <= sizeof(unsigned PY_LONG_LONG)) {
+                __PYX_VERIFY_RETURN_INT_EXC(npy_int64, unsigned PY_LONG_LONG, PyLong_AsUnsignedLongLong(x))
+#endif
+            }
+        } else {
+#if CYTHON_USE_PYLONG_INTERNALS
+            const digit* digits = ((PyLongObject*)x)->ob_digit;
+            switch (Py_SIZE(x)) {
+                case  0: return (npy_int64) 0;
+                case -1: __PYX_VERIFY_RETURN_INT(npy_int64, sdigit, (sdigit) (-(sdigit)digits[0]))
+                case  1: __PYX_VERIFY_RETURN_INT(npy_int64,  digit, +digits[0])
+                case -2:
+                    if (8 * sizeof(npy_int64) - 1 > 1 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 2 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_int64, long, -(long) (((((unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_int64) - 1 > 2 * PyLong_SHIFT) {
+                            return (npy_int64) (((npy_int64)-1)*(((((npy_int64)digits[1]) << PyLong_SHIFT) | (npy_int64)digits[0])));
+                        }
+                    }
+                    break;
+                case 2:
+                    if (8 * sizeof(npy_int64) > 1 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 2 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_int64, unsigned long, (((((unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_int64) - 1 > 2 * PyLong_SHIFT) {
+                            return (npy_int64) ((((((npy_int64)digits[1]) << PyLong_SHIFT) | (npy_int64)digits[0])));
+                        }
+                    }
+                    break;
+                case -3:
+                    if (8 * sizeof(npy_int64) - 1 > 2 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 3 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_int64, long, -(long) (((((((unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_int64) - 1 > 3 * PyLong_SHIFT) {
+                            return (npy_int64) (((npy_int64)-1)*(((((((npy_int64)digits[2]) << PyLong_SHIFT) | (npy_int64)digits[1]) << PyLong_SHIFT) | (npy_int64)digits[0])));
+                        }
+                    }
+                    break;
+                case 3:
+                    if (8 * sizeof(npy_int64) > 2 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 3 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_int64, unsigned long, (((((((unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_int64) - 1 > 3 * PyLong_SHIFT) {
+                            return (npy_int64) ((((((((npy_int64)digits[2]) << PyLong_SHIFT) | (npy_int64)digits[1]) << PyLong_SHIFT) | (npy_int64)digits[0])));
+                        }
+                    }
+                    break;
+                case -4:
+                    if (8 * sizeof(npy_int64) - 1 > 3 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 4 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_int64, long, -(long) (((((((((unsigned long)digits[3]) << PyLong_SHIFT) | (unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_int64) - 1 > 4 * PyLong_SHIFT) {
+                            return (npy_int64) (((npy_int64)-1)*(((((((((npy_int64)digits[3]) << PyLong_SHIFT) | (npy_int64)digits[2]) << PyLong_SHIFT) | (npy_int64)digits[1]) << PyLong_SHIFT) | (npy_int64)digits[0])));
+                        }
+                    }
+                    break;
+                case 4:
+                    if (8 * sizeof(npy_int64) > 3 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 4 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_int64, unsigned long, (((((((((unsigned long)digits[3]) << PyLong_SHIFT) | (unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_int64) - 1 > 4 * PyLong_SHIFT) {
+                            return (npy_int64) ((((((((((npy_int64)digits[3]) << PyLong_SHIFT) | (npy_int64)digits[2]) << PyLong_SHIFT) | (npy_int64)digits[1]) << PyLong_SHIFT) | (npy_int64)digits[0])));
+                        }
+                    }
+                    break;
+            }
+#endif
+            if (sizeof(npy_int64) <= sizeof(long)) {
+                __PYX_VERIFY_RETURN_INT_EXC(npy_int64, long, PyLong_AsLong(x))
+#ifdef HAVE_LONG_LONG
+            } else if (sizeof(npy_int64) <= sizeof(PY_LONG_LONG)) {
+                __PYX_VERIFY_RETURN_INT_EXC(npy_int64, PY_LONG_LONG, PyLong_AsLongLong(x))
+#endif
+            }
+        }
+        {
+#if CYTHON_COMPILING_IN_PYPY && !defined(_PyLong_AsByteArray)
+            PyErr_SetString(PyExc_RuntimeError,
+                            "_PyLong_AsByteArray() not available in PyPy, cannot convert large numbers");
+#else
+            npy_int64 val;
+            PyObject *v = __Pyx_PyNumber_IntOrLong(x);
+ #if PY_MAJOR_VERSION < 3
+            if (likely(v) && !PyLong_Check(v)) {
+                PyObject *tmp = v;
+                v = PyNumber_Long(tmp);
+                Py_DECREF(tmp);
+            }
+ #endif
+            if (likely(v)) {
+                int one = 1; int is_little = (int)*(unsigned char *)&one;
+                unsigned char *bytes = (unsigned char *)&val;
+                int ret = _PyLong_AsByteArray((PyLongObject *)v,
+                                              bytes, sizeof(val),
+                                              is_little, !is_unsigned);
+                Py_DECREF(v);
+                if (likely(!ret))
+                    return val;
+            }
+#endif
+            return (npy_int64) -1;
+        }
+    } else {
+        npy_int64 val;
+        PyObject *tmp = __Pyx_PyNumber_IntOrLong(x);
+        if (!tmp) return (npy_int64) -1;
+        val = __Pyx_PyInt_As_npy_int64(tmp);
+        Py_DECREF(tmp);
+        return val;
+    }
+raise_overflow:
+    PyErr_SetString(PyExc_OverflowError,
+        "value too large to convert to npy_int64");
+    return (npy_int64) -1;
+raise_neg_overflow:
+    PyErr_SetString(PyExc_OverflowError,
+        "can't convert negative value to npy_int64");
+    return (npy_int64) -1;
+}
+
+/* CIntFromPy */
+  static CYTHON_INLINE npy_long __Pyx_PyInt_As_npy_long(PyObject *x) {
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic push
+#pragma GCC diagnostic ignored "-Wconversion"
+#endif
+    const npy_long neg_one = (npy_long) -1, const_zero = (npy_long) 0;
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic pop
+#endif
+    const int is_unsigned = neg_one > const_zero;
+#if PY_MAJOR_VERSION < 3
+    if (likely(PyInt_Check(x))) {
+        if (sizeof(npy_long) < sizeof(long)) {
+            __PYX_VERIFY_RETURN_INT(npy_long, long, PyInt_AS_LONG(x))
+        } else {
+            long val = PyInt_AS_LONG(x);
+            if (is_unsigned && unlikely(val < 0)) {
+                goto raise_neg_overflow;
+            }
+            return (npy_long) val;
+        }
+    } else
+#endif
+    if (likely(PyLong_Check(x))) {
+        if (is_unsigned) {
+#if CYTHON_USE_PYLONG_INTERNALS
+            const digit* digits = ((PyLongObject*)x)->ob_digit;
+            switch (Py_SIZE(x)) {
+                case  0: return (npy_long) 0;
+                case  1: __PYX_VERIFY_RETURN_INT(npy_long, digit, digits[0])
+                case 2:
+                    if (8 * sizeof(npy_long) > 1 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 2 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_long, unsigned long, (((((unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_long) >= 2 * PyLong_SHIFT) {
+                            return (npy_long) (((((npy_long)digits[1]) << PyLong_SHIFT) | (npy_long)digits[0]));
+                        }
+                    }
+                    break;
+                case 3:
+                    if (8 * sizeof(npy_long) > 2 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 3 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_long, unsigned long, (((((((unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_long) >= 3 * PyLong_SHIFT) {
+                            return (npy_long) (((((((npy_long)digits[2]) << PyLong_SHIFT) | (npy_long)digits[1]) << PyLong_SHIFT) | (npy_long)digits[0]));
+                        }
+                    }
+                    break;
+                case 4:
+                    if (8 * sizeof(npy_long) > 3 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 4 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_long, unsigned long, (((((((((unsigned long)digits[3]) << PyLong_SHIFT) | (unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_long) >= 4 * PyLong_SHIFT) {
+                            return (npy_long) (((((((((npy_long)digits[3]) << PyLong_SHIFT) | (npy_long)digits[2]) << PyLong_SHIFT) | (npy_long)digits[1]) << PyLong_SHIFT) | (npy_long)digits[0]));
+                        }
+                    }
+                    break;
+            }
+#endif
+#if CYTHON_COMPILING_IN_CPYTHON && PY_VERSION_HEX < 0x030C00A7
+            if (unlikely(Py_SIZE(x) < 0)) {
+                goto raise_neg_overflow;
+            }
+#else
+            {
+                int result = PyObject_RichCompareBool(x, Py_False, Py_LT);
+                if (unlikely(result < 0))
+                    return (npy_long) -1;
+                if (unlikely(result == 1))
+                    goto raise_neg_overflow;
+            }
+#endif
+            if (sizeof(npy_long) <= sizeof(unsigned long)) {
+                __PYX_VERIFY_RETURN_INT_EXC(npy_long, unsigned long, PyLong_AsUnsignedLong(x))
+#ifdef HAVE_LONG_LONG
+            } else if (sizeof(npy_long) <= sizeof(unsigned PY_LONG_LONG)) {
+                __PYX_VERIFY_RETURN_INT_EXC(npy_long, unsigned PY_LONG_LONG, PyLong_AsUnsignedLongLong(x))
+#endif
+            }
+        } else {
+#if CYTHON_USE_PYLONG_INTERNALS
+            const digit* digits = ((PyLongObject*)x)->ob_digit;
+            switch (Py_SIZE(x)) {
+                case  0: return (npy_long) 0;
+                case -1: __PYX_VERIFY_RETURN_INT(npy_long, sdigit, (sdigit) (-(sdigit)digits[0]))
+                case  1: __PYX_VERIFY_RETURN_INT(npy_long,  digit, +digits[0])
+                case -2:
+                    if (8 * sizeof(npy_long) - 1 > 1 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 2 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_long, long, -(long) (((((unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_long) - 1 > 2 * PyLong_SHIFT) {
+                            return (npy_long) (((npy_long)-1)*(((((npy_long)digits[1]) << PyLong_SHIFT) | (npy_long)digits[0])));
+                        }
+                    }
+                    break;
+                case 2:
+                    if (8 * sizeof(npy_long) > 1 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 2 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_long, unsigned long, (((((unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_long) - 1 > 2 * PyLong_SHIFT) {
+                            return (npy_long) ((((((npy_long)digits[1]) << PyLong_SHIFT) | (npy_long)digits[0])));
+                        }
+                    }
+                    break;
+                case -3:
+                    if (8 * sizeof(npy_long) - 1 > 2 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 3 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_long, long, -(long) (((((((unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_long) - 1 > 3 * PyLong_SHIFT) {
+                            return (npy_long) (((npy_long)-1)*(((((((npy_long)digits[2]) << PyLong_SHIFT) | (npy_long)digits[1]) << PyLong_SHIFT) | (npy_long)digits[0])));
+                        }
+                    }
+                    break;
+                case 3:
+                    if (8 * sizeof(npy_long) > 2 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 3 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_long, unsigned long, (((((((unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_long) - 1 > 3 * PyLong_SHIFT) {
+                            return (npy_long) ((((((((npy_long)digits[2]) << PyLong_SHIFT) | (npy_long)digits[1]) << PyLong_SHIFT) | (npy_long)digits[0])));
+                        }
+                    }
+                    break;
+                case -4:
+                    if (8 * sizeof(npy_long) - 1 > 3 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 4 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_long, long, -(long) (((((((((unsigned long)digits[3]) << PyLong_SHIFT) | (unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_long) - 1 > 4 * PyLong_SHIFT) {
+                            return (npy_long) (((npy_long)-1)*(((((((((npy_long)digits[3]) << PyLong_SHIFT) | (npy_long)digits[2]) << PyLong_SHIFT) | (npy_long)digits[1]) << PyLong_SHIFT) | (npy_long)digits[0])));
+                        }
+                    }
+                    break;
+                case 4:
+                    if (8 * sizeof(npy_long) > 3 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 4 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(npy_long, unsigned long, (((((((((unsigned long)digits[3]) << PyLong_SHIFT) | (unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(npy_long) - 1 > 4 * PyLong_SHIFT) {
+                            return (npy_long) ((((((((((npy_long)digits[3]) << PyLong_SHIFT) | (npy_long)digits[2]) << PyLong_SHIFT) | (npy_long)digits[1]) << PyLong_SHIFT) | (npy_long)digits[0])));
+                        }
+                    }
+                    break;
+            }
+#endif
+            if (sizeof(npy_long) <= sizeof(long)) {
+                __PYX_VERIFY_RETURN_INT_EXC(npy_long, long, PyLong_AsLong(x))
+#ifdef HAVE_LONG_LONG
+            } else if (sizeof(npy_long) <= sizeof(PY_LONG_LONG)) {
+                __PYX_VERIFY_RETURN_INT_EXC(npy_long, PY_LONG_LONG, PyLong_AsLongLong(x))
+#endif
+            }
+        }
+        {
+#if CYTHON_COMPILING_IN_PYPY && !defined(_PyLong_AsByteArray)
+            PyErr_SetString(PyExc_RuntimeError,
+                            "_PyLong_AsByteArray() not available in PyPy, cannot convert large numbers");
+#else
+            npy_long val;
+            PyObject *v = __Pyx_PyNumber_IntOrLong(x);
+ #if PY_MAJOR_VERSION < 3
+            if (likely(v) && !PyLong_Check(v)) {
+                PyObject *tmp = v;
+                v = PyNumber_Long(tmp);
+                Py_DECREF(tmp);
+            }
+ #endif
+            if (likely(v)) {
+                int one = 1; int is_little = (int)*(unsigned char *)&one;
+                unsigned char *bytes = (unsigned char *)&val;
+                int ret = _PyLong_AsByteArray((PyLongObject *)v,
+                                              bytes, sizeof(val),
+                                              is_little, !is_unsigned);
+                Py_DECREF(v);
+                if (likely(!ret))
+                    return val;
+            }
+#endif
+            return (npy_long) -1;
+        }
+    } else {
+        npy_long val;
+        PyObject *tmp = __Pyx_PyNumber_IntOrLong(x);
+        if (!tmp) return (npy_long) -1;
+        val = __Pyx_PyInt_As_npy_long(tmp);
+        Py_DECREF(tmp);
+        return val;
+    }
+raise_overflow:
+    PyErr_SetString(PyExc_OverflowError,
+        "value too large to convert to npy_long");
+    return (npy_long) -1;
+raise_neg_overflow:
+    PyErr_SetString(PyExc_OverflowError,
+        "can't convert negative value to npy_long");
+    return (npy_long) -1;
+}
+
+/* CIntToPy */
+  static CYTHON_INLINE PyObject* __Pyx_PyInt_From_npy_int64(npy_int64 value) {
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic push
+#pragma GCC diagnostic ignored "-Wconversion"
+#endif
+    const npy_int64 neg_one = (npy_int64) -1, const_zero = (npy_int64) 0;
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic pop
+#endif
+    const int is_unsigned = neg_one > const_zero;
+    if (is_unsigned) {
+        if (sizeof(npy_int64) < sizeof(long)) {
+            return PyInt_FromLong((long) value);
+        } else if (sizeof(npy_int64) <= sizeof(unsigned long)) {
+            return PyLong_FromUnsignedLong((unsigned long) value);
+#ifdef HAVE_LONG_LONG
+        } else if (sizeof(npy_int64) <= sizeof(unsigned PY_LONG_LONG)) {
+            return PyLong_FromUnsignedLongLong((unsigned PY_LONG_LONG) value);
+#endif
+        }
+    } else {
+        if (sizeof(npy_int64) <= sizeof(long)) {
+            return PyInt_FromLong((long) value);
+#ifdef HAVE_LONG_LONG
+        } else if (sizeof(npy_int64) <= sizeof(PY_LONG_LONG)) {
+            return PyLong_FromLongLong((PY_LONG_LONG) value);
+#endif
+        }
+    }
+    {
+        int one = 1; int little = (int)*(unsigned char *)&one;
+        unsigned char *bytes = (unsigned char *)&value;
+        return _PyLong_FromByteArray(bytes, sizeof(npy_int64),
+                                     little, !is_unsigned);
+    }
+}
+
+/* CIntToPy */
+  static CYTHON_INLINE PyObject* __Pyx_PyInt_From_npy_long(npy_long value) {
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic push
+#pragma GCC diagnostic ignored "-Wconversion"
+#endif
+    const npy_long neg_one = (npy_long) -1, const_zero = (npy_long) 0;
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic pop
+#endif
+    const int is_unsigned = neg_one > const_zero;
+    if (is_unsigned) {
+        if (sizeof(npy_long) < sizeof(long)) {
+            return PyInt_FromLong((long) value);
+        } else if (sizeof(npy_long) <= sizeof(unsigned long)) {
+            return PyLong_FromUnsignedLong((unsigned long) value);
+#ifdef HAVE_LONG_LONG
+        } else if (sizeof(npy_long) <= sizeof(unsigned PY_LONG_LONG)) {
+            return PyLong_FromUnsignedLongLong((unsigned PY_LONG_LONG) value);
+#endif
+        }
+    } else {
+        if (sizeof(npy_long) <= sizeof(long)) {
+            return PyInt_FromLong((long) value);
+#ifdef HAVE_LONG_LONG
+        } else if (sizeof(npy_long) <= sizeof(PY_LONG_LONG)) {
+            return PyLong_FromLongLong((PY_LONG_LONG) value);
+#endif
+        }
+    }
+    {
+        int one = 1; int little = (int)*(unsigned char *)&one;
+        unsigned char *bytes = (unsigned char *)&value;
+        return _PyLong_FromByteArray(bytes, sizeof(npy_long),
+                                     little, !is_unsigned);
+    }
+}
+
+/* CIntToPy */
+  static CYTHON_INLINE PyObject* __Pyx_PyInt_From_npy_uint8(npy_uint8 value) {
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic push
+#pragma GCC diagnostic ignored "-Wconversion"
+#endif
+    const npy_uint8 neg_one = (npy_uint8) -1, const_zero = (npy_uint8) 0;
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic pop
+#endif
+    const int is_unsigned = neg_one > const_zero;
+    if (is_unsigned) {
+        if (sizeof(npy_uint8) < sizeof(long)) {
+            return PyInt_FromLong((long) value);
+        } else if (sizeof(npy_uint8) <= sizeof(unsigned long)) {
+            return PyLong_FromUnsignedLong((unsigned long) value);
+#ifdef HAVE_LONG_LONG
+        } else if (sizeof(npy_uint8) <= sizeof(unsigned PY_LONG_LONG)) {
+            return PyLong_FromUnsignedLongLong((unsigned PY_LONG_LONG) value);
+#endif
+        }
+    } else {
+        if (sizeof(npy_uint8) <= sizeof(long)) {
+            return PyInt_FromLong((long) value);
+#ifdef HAVE_LONG_LONG
+        } else if (sizeof(npy_uint8) <= sizeof(PY_LONG_LONG)) {
+            return PyLong_FromLongLong((PY_LONG_LONG) value);
+#endif
+        }
+    }
+    {
+        int one = 1; int little = (int)*(unsigned char *)&one;
+        unsigned char *bytes = (unsigned char *)&value;
+        return _PyLong_FromByteArray(bytes, sizeof(npy_uint8),
+                                     little, !is_unsigned);
+    }
+}
+
+/* CIntFromPy */
+  static CYTHON_INLINE long __Pyx_PyInt_As_long(PyObject *x) {
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic push
+#pragma GCC diagnostic ignored "-Wconversion"
+#endif
+    const long neg_one = (long) -1, const_zero = (long) 0;
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic pop
+#endif
+    const int is_unsigned = neg_one > const_zero;
+#if PY_MAJOR_VERSION < 3
+    if (likely(PyInt_Check(x))) {
+        if (sizeof(long) < sizeof(long)) {
+            __PYX_VERIFY_RETURN_INT(long, long, PyInt_AS_LONG(x))
+        } else {
+            long val = PyInt_AS_LONG(x);
+            if (is_unsigned && unlikely(val < 0)) {
+                goto raise_neg_overflow;
+            }
+            return (long) val;
+        }
+    } else
+#endif
+    if (likely(PyLong_Check(x))) {
+        if (is_unsigned) {
+#if CYTHON_USE_PYLONG_INTERNALS
+            const digit* digits = ((PyLongObject*)x)->ob_digit;
+            switch (Py_SIZE(x)) {
+                case  0: return (long) 0;
+                case  1: __PYX_VERIFY_RETURN_INT(long, digit, digits[0])
+                case 2:
+                    if (8 * sizeof(long) > 1 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 2 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(long, unsigned long, (((((unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(long) >= 2 * PyLong_SHIFT) {
+                            return (long) (((((long)digits[1]) << PyLong_SHIFT) | (long)digits[0]));
+                        }
+                    }
+                    break;
+                case 3:
+                    if (8 * sizeof(long) > 2 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 3 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(long, unsigned long, (((((((unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(long) >= 3 * PyLong_SHIFT) {
+                            return (long) (((((((long)digits[2]) << PyLong_SHIFT) | (long)digits[1]) << PyLong_SHIFT) | (long)digits[0]));
+                        }
+                    }
+                    break;
+                case 4:
+                    if (8 * sizeof(long) > 3 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 4 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(long, unsigned long, (((((((((unsigned long)digits[3]) << PyLong_SHIFT) | (unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(long) >= 4 * PyLong_SHIFT) {
+                            return (long) (((((((((long)digits[3]) << PyLong_SHIFT) | (long)digits[2]) << PyLong_SHIFT) | (long)digits[1]) << PyLong_SHIFT) | (long)digits[0]));
+                        }
+                    }
+                    break;
+            }
+#endif
+#if CYTHON_COMPILING_IN_CPYTHON && PY_VERSION_HEX < 0x030C00A7
+            if (unlikely(Py_SIZE(x) < 0)) {
+                goto raise_neg_overflow;
+            }
+#else
+            {
+                int result = PyObject_RichCompareBool(x, Py_False, Py_LT);
+                if (unlikely(result < 0))
+                    return (long) -1;
+                if (unlikely(result == 1))
+                    goto raise_neg_overflow;
+            }
+#endif
+            if (sizeof(long) <= sizeof(unsigned long)) {
+                __PYX_VERIFY_RETURN_INT_EXC(long, unsigned long, PyLong_AsUnsignedLong(x))
+#ifdef HAVE_LONG_LONG
+            } else if (sizeof(long) <= sizeof(unsigned PY_LONG_LONG)) {
+                __PYX_VERIFY_RETURN_INT_EXC(long, unsigned PY_LONG_LONG, PyLong_AsUnsignedLongLong(x))
+#endif
+            }
+        } else {
+#if CYTHON_USE_PYLONG_INTERNALS
+            const digit* digits = ((PyLongObject*)x)->ob_digit;
+            switch (Py_SIZE(x)) {
+                case  0: return (long) 0;
+                case -1: __PYX_VERIFY_RETURN_INT(long, sdigit, (sdigit) (-(sdigit)digits[0]))
+                case  1: __PYX_VERIFY_RETURN_INT(long,  digit, +digits[0])
+                case -2:
+                    if (8 * sizeof(long) - 1 > 1 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 2 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(long, long, -(long) (((((unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(long) - 1 > 2 * PyLong_SHIFT) {
+                            return (long) (((long)-1)*(((((long)digits[1]) << PyLong_SHIFT) | (long)digits[0])));
+                        }
+                    }
+                    break;
+                case 2:
+                    if (8 * sizeof(long) > 1 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 2 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(long, unsigned long, (((((unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(long) - 1 > 2 * PyLong_SHIFT) {
+                            return (long) ((((((long)digits[1]) << PyLong_SHIFT) | (long)digits[0])));
+                        }
+                    }
+                    break;
+                case -3:
+                    if (8 * sizeof(long) - 1 > 2 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 3 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(long, long, -(long) (((((((unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(long) - 1 > 3 * PyLong_SHIFT) {
+                            return (long) (((long)-1)*(((((((long)digits[2]) << PyLong_SHIFT) | (long)digits[1]) << PyLong_SHIFT) | (long)digits[0])));
+                        }
+                    }
+                    break;
+                case 3:
+                    if (8 * sizeof(long) > 2 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 3 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(long, unsigned long, (((((((unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(long) - 1 > 3 * PyLong_SHIFT) {
+                            return (long) ((((((((long)digits[2]) << PyLong_SHIFT) | (long)digits[1]) << PyLong_SHIFT) | (long)digits[0])));
+                        }
+                    }
+                    break;
+                case -4:
+                    if (8 * sizeof(long) - 1 > 3 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 4 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(long, long, -(long) (((((((((unsigned long)digits[3]) << PyLong_SHIFT) | (unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(long) - 1 > 4 * PyLong_SHIFT) {
+                            return (long) (((long)-1)*(((((((((long)digits[3]) << PyLong_SHIFT) | (long)digits[2]) << PyLong_SHIFT) | (long)digits[1]) << PyLong_SHIFT) | (long)digits[0])));
+                        }
+                    }
+                    break;
+                case 4:
+                    if (8 * sizeof(long) > 3 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 4 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(long, unsigned long, (((((((((unsigned long)digits[3]) << PyLong_SHIFT) | (unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(long) - 1 > 4 * PyLong_SHIFT) {
+                            return (long) ((((((((((long)digits[3]) << PyLong_SHIFT) | (long)digits[2]) << PyLong_SHIFT) | (long)digits[1]) << PyLong_SHIFT) | (long)digits[0])));
+                        }
+                    }
+                    break;
+            }
+#endif
+            if (sizeof(long) <= sizeof(long)) {
+                __PYX_VERIFY_RETURN_INT_EXC(long, long, PyLong_AsLong(x))
+#ifdef HAVE_LONG_LONG
+            } else if (sizeof(long) <= sizeof(PY_LONG_LONG)) {
+                __PYX_VERIFY_RETURN_INT_EXC(long, PY_LONG_LONG, PyLong_AsLongLong(x))
+#endif
+            }
+        }
+        {
+#if CYTHON_COMPILING_IN_PYPY && !defined(_PyLong_AsByteArray)
+            PyErr_SetString(PyExc_RuntimeError,
+                            "_PyLong_AsByteArray() not available in PyPy, cannot convert large numbers");
+#else
+            long val;
+            PyObject *v = __Pyx_PyNumber_IntOrLong(x);
+ #if PY_MAJOR_VERSION < 3
+            if (likely(v) && !PyLong_Check(v)) {
+                PyObject *tmp = v;
+                v = PyNumber_Long(tmp);
+                Py_DECREF(tmp);
+            }
+ #endif
+            if (likely(v)) {
+                int one = 1; int is_little = (int)*(unsigned char *)&one;
+                unsigned char *bytes = (unsigned char *)&val;
+                int ret = _PyLong_AsByteArray((PyLongObject *)v,
+                                              bytes, sizeof(val),
+                                              is_little, !is_unsigned);
+                Py_DECREF(v);
+                if (likely(!ret))
+                    return val;
+            }
+#endif
+            return (long) -1;
+        }
+    } else {
+        long val;
+        PyObject *tmp = __Pyx_PyNumber_IntOrLong(x);
+        if (!tmp) return (long) -1;
+        val = __Pyx_PyInt_As_long(tmp);
+        Py_DECREF(tmp);
+        return val;
+    }
+raise_overflow:
+    PyErr_SetString(PyExc_OverflowError,
+        "value too large to convert to long");
+    return (long) -1;
+raise_neg_overflow:
+    PyErr_SetString(PyExc_OverflowError,
+        "can't convert negative value to long");
+    return (long) -1;
+}
+
+/* CIntToPy */
+  static CYTHON_INLINE PyObject* __Pyx_PyInt_From_long(long value) {
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic push
+#pragma GCC diagnostic ignored "-Wconversion"
+#endif
+    const long neg_one = (long) -1, const_zero = (long) 0;
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic pop
+#endif
+    const int is_unsigned = neg_one > const_zero;
+    if (is_unsigned) {
+        if (sizeof(long) < sizeof(long)) {
+            return PyInt_FromLong((long) value);
+        } else if (sizeof(long) <= sizeof(unsigned long)) {
+            return PyLong_FromUnsignedLong((unsigned long) value);
+#ifdef HAVE_LONG_LONG
+        } else if (sizeof(long) <= sizeof(unsigned PY_LONG_LONG)) {
+            return PyLong_FromUnsignedLongLong((unsigned PY_LONG_LONG) value);
+#endif
+        }
+    } else {
+        if (sizeof(long) <= sizeof(long)) {
+            return PyInt_FromLong((long) value);
+#ifdef HAVE_LONG_LONG
+        } else if (sizeof(long) <= sizeof(PY_LONG_LONG)) {
+            return PyLong_FromLongLong((PY_LONG_LONG) value);
+#endif
+        }
+    }
+    {
+        int one = 1; int little = (int)*(unsigned char *)&one;
+        unsigned char *bytes = (unsigned char *)&value;
+        return _PyLong_FromByteArray(bytes, sizeof(long),
+                                     little, !is_unsigned);
+    }
+}
+
+/* CIntFromPy */
+  static CYTHON_INLINE int __Pyx_PyInt_As_int(PyObject *x) {
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic push
+#pragma GCC diagnostic ignored "-Wconversion"
+#endif
+    const int neg_one = (int) -1, const_zero = (int) 0;
+#ifdef __Pyx_HAS_GCC_DIAGNOSTIC
+#pragma GCC diagnostic pop
+#endif
+    const int is_unsigned = neg_one > const_zero;
+#if PY_MAJOR_VERSION < 3
+    if (likely(PyInt_Check(x))) {
+        if (sizeof(int) < sizeof(long)) {
+            __PYX_VERIFY_RETURN_INT(int, long, PyInt_AS_LONG(x))
+        } else {
+            long val = PyInt_AS_LONG(x);
+            if (is_unsigned && unlikely(val < 0)) {
+                goto raise_neg_overflow;
+            }
+            return (int) val;
+        }
+    } else
+#endif
+    if (likely(PyLong_Check(x))) {
+        if (is_unsigned) {
+#if CYTHON_USE_PYLONG_INTERNALS
+            const digit* digits = ((PyLongObject*)x)->ob_digit;
+            switch (Py_SIZE(x)) {
+                case  0: return (int) 0;
+                case  1: __PYX_VERIFY_RETURN_INT(int, digit, digits[0])
+                case 2:
+                    if (8 * sizeof(int) > 1 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 2 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(int, unsigned long, (((((unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(int) >= 2 * PyLong_SHIFT) {
+                            return (int) (((((int)digits[1]) << PyLong_SHIFT) | (int)digits[0]));
+                        }
+                    }
+                    break;
+                case 3:
+                    if (8 * sizeof(int) > 2 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 3 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(int, unsigned long, (((((((unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(int) >= 3 * PyLong_SHIFT) {
+                            return (int) (((((((int)digits[2]) << PyLong_SHIFT) | (int)digits[1]) << PyLong_SHIFT) | (int)digits[0]));
+                        }
+                    }
+                    break;
+                case 4:
+                    if (8 * sizeof(int) > 3 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 4 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(int, unsigned long, (((((((((unsigned long)digits[3]) << PyLong_SHIFT) | (unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(int) >= 4 * PyLong_SHIFT) {
+                            return (int) (((((((((int)digits[3]) << PyLong_SHIFT) | (int)digits[2]) << PyLong_SHIFT) | (int)digits[1]) << PyLong_SHIFT) | (int)digits[0]));
+                        }
+                    }
+                    break;
+            }
+#endif
+#if CYTHON_COMPILING_IN_CPYTHON && PY_VERSION_HEX < 0x030C00A7
+            if (unlikely(Py_SIZE(x) < 0)) {
+                goto raise_neg_overflow;
+            }
+#else
+            {
+                int result = PyObject_RichCompareBool(x, Py_False, Py_LT);
+                if (unlikely(result < 0))
+                    return (int) -1;
+                if (unlikely(result == 1))
+                    goto raise_neg_overflow;
+            }
+#endif
+            if (sizeof(int) <= sizeof(unsigned long)) {
+                __PYX_VERIFY_RETURN_INT_EXC(int, unsigned long, PyLong_AsUnsignedLong(x))
+#ifdef HAVE_LONG_LONG
+            } else if (sizeof(int) <= sizeof(unsigned PY_LONG_LONG)) {
+                __PYX_VERIFY_RETURN_INT_EXC(int, unsigned PY_LONG_LONG, PyLong_AsUnsignedLongLong(x))
+#endif
+            }
+        } else {
+#if CYTHON_USE_PYLONG_INTERNALS
+            const digit* digits = ((PyLongObject*)x)->ob_digit;
+            switch (Py_SIZE(x)) {
+                case  0: return (int) 0;
+                case -1: __PYX_VERIFY_RETURN_INT(int, sdigit, (sdigit) (-(sdigit)digits[0]))
+                case  1: __PYX_VERIFY_RETURN_INT(int,  digit, +digits[0])
+                case -2:
+                    if (8 * sizeof(int) - 1 > 1 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 2 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(int, long, -(long) (((((unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(int) - 1 > 2 * PyLong_SHIFT) {
+                            return (int) (((int)-1)*(((((int)digits[1]) << PyLong_SHIFT) | (int)digits[0])));
+                        }
+                    }
+                    break;
+                case 2:
+                    if (8 * sizeof(int) > 1 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 2 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(int, unsigned long, (((((unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(int) - 1 > 2 * PyLong_SHIFT) {
+                            return (int) ((((((int)digits[1]) << PyLong_SHIFT) | (int)digits[0])));
+                        }
+                    }
+                    break;
+                case -3:
+                    if (8 * sizeof(int) - 1 > 2 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 3 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(int, long, -(long) (((((((unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(int) - 1 > 3 * PyLong_SHIFT) {
+                            return (int) (((int)-1)*(((((((int)digits[2]) << PyLong_SHIFT) | (int)digits[1]) << PyLong_SHIFT) | (int)digits[0])));
+                        }
+                    }
+                    break;
+                case 3:
+                    if (8 * sizeof(int) > 2 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 3 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(int, unsigned long, (((((((unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(int) - 1 > 3 * PyLong_SHIFT) {
+                            return (int) ((((((((int)digits[2]) << PyLong_SHIFT) | (int)digits[1]) << PyLong_SHIFT) | (int)digits[0])));
+                        }
+                    }
+                    break;
+                case -4:
+                    if (8 * sizeof(int) - 1 > 3 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 4 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(int, long, -(long) (((((((((unsigned long)digits[3]) << PyLong_SHIFT) | (unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(int) - 1 > 4 * PyLong_SHIFT) {
+                            return (int) (((int)-1)*(((((((((int)digits[3]) << PyLong_SHIFT) | (int)digits[2]) << PyLong_SHIFT) | (int)digits[1]) << PyLong_SHIFT) | (int)digits[0])));
+                        }
+                    }
+                    break;
+                case 4:
+                    if (8 * sizeof(int) > 3 * PyLong_SHIFT) {
+                        if (8 * sizeof(unsigned long) > 4 * PyLong_SHIFT) {
+                            __PYX_VERIFY_RETURN_INT(int, unsigned long, (((((((((unsigned long)digits[3]) << PyLong_SHIFT) | (unsigned long)digits[2]) << PyLong_SHIFT) | (unsigned long)digits[1]) << PyLong_SHIFT) | (unsigned long)digits[0])))
+                        } else if (8 * sizeof(int) - 1 > 4 * PyLong_SHIFT) {
+                            return (int) ((((((((((int)digits[3]) << PyLong_SHIFT) | (int)digits[2]) << PyLong_SHIFT) | (int)digits[1]) << PyLong_SHIFT) | (int)digits[0])));
+                        }
+                    }
+                    break;
+            }
+#endif
+            if (sizeof(int) <= sizeof(long)) {
+                __PYX_VERIFY_RETURN_INT_EXC(int, long, PyLong_AsLong(x))
+#ifdef HAVE_LONG_LONG
+            } else if (sizeof(int) <= sizeof(PY_LONG_LONG)) {
+                __PYX_VERIFY_RETURN_INT_EXC(int, PY_LONG_LONG, PyLong_AsLongLong(x))
+#endif
+            }
+        }
+        {
+#if CYTHON_COMPILING_IN_PYPY && !defined(_PyLong_AsByteArray)
+            PyErr_SetString(PyExc_RuntimeError,
+                            "_PyLong_AsByteArray() not available in PyPy, cannot convert large numbers");
+#else
+            int val;
+            PyObject *v = __Pyx_PyNumber_IntOrLong(x);
+ #if PY_MAJOR_VERSION < 3
+            if (likely(v) && !PyLong_Check(v)) {
+                PyObject *tmp = v;
+                v = PyNumber_Long(tmp);
+                Py_DECREF(tmp);
+            }
+ #endif
+            if (likely(v)) {
+                int one = 1; int is_little = (int)*(unsigned char *)&one;
+                unsigned char *bytes = (unsigned char *)&val;
+                int ret = _PyLong_AsByteArray((PyLongObject *)v,
+                                              bytes, sizeof(val),
+                                              is_little, !is_unsigned);
+                Py_DECREF(v);
+                if (likely(!ret))
+                    return val;
+            }
+#endif
+            return (int) -1;
+        }
+    } else {
+        int val;
+        PyObject *tmp = __Pyx_PyNumber_IntOrLong(x);
+        if (!tmp) return (int) -1;
+        val = __Pyx_PyInt_As_int(tmp);
+        Py_DECREF(tmp);
+        return val;
+    }
+raise_overflow:
+    PyErr_SetString(PyExc_OverflowError,
+        "value too large to convert to int");
+    return (int) -1;
+raise_neg_overflow:
+    PyErr_SetString(PyExc_OverflowError,
+        "can't convert negative value to int");
+    return (int) -1;
+}
+
+/* FastTypeChecks */
+  #if CYTHON_COMPILING_IN_CPYTHON
+static int __Pyx_InBases(PyTypeObject *a, PyTypeObject *b) {
+    while (a) {
+        a = a->tp_base;
+        if (a == b)
+            return 1;
+    }
+    return b == &PyBaseObject_Type;
+}
+static CYTHON_INLINE int __Pyx_IsSubtype(PyTypeObject *a, PyTypeObject *b) {
+    PyObject *mro;
+    if (a == b) return 1;
+    mro = a->tp_mro;
+    if (likely(mro)) {
+        Py_ssize_t i, n;
+        n = PyTuple_GET_SIZE(mro);
+        for (i = 0; i < n; i++) {
+            if (PyTuple_GET_ITEM(mro, i) == (PyObject *)b)
+                return 1;
+        }
+        return 0;
+    }
+    return __Pyx_InBases(a, b);
+}
+#if PY_MAJOR_VERSION == 2
+static int __Pyx_inner_PyErr_GivenExceptionMatches2(PyObject *err, PyObject* exc_type1, PyObject* exc_type2) {
+    PyObject *exception, *value, *tb;
+    int res;
+    __Pyx_PyThreadState_declare
+    __Pyx_PyThreadState_assign
+    __Pyx_ErrFetch(&exception, &value, &tb);
+    res = exc_type1 ? PyObject_IsSubclass(err, exc_type1) : 0;
+    if (unlikely(res == -1)) {
+        PyErr_WriteUnraisable(err);
+        res = 0;
+    }
+    if (!res) {
+        res = PyObject_IsSubclass(err, exc_type2);
+        if (unlikely(res == -1)) {
+            PyErr_WriteUnraisable(err);
+            res = 0;
+        }
+    }
+    __Pyx_ErrRestore(exception, value, tb);
+    return res;
+}
+#else
+static CYTHON_INLINE int __Pyx_inner_PyErr_GivenExceptionMatches2(PyObject *err, PyObject* exc_type1, PyObject *exc_type2) {
+    int res = exc_type1 ? __Pyx_IsSubtype((PyTypeObject*)err, (PyTypeObject*)exc_type1) : 0;
+    if (!res) {
+        res = __Pyx_IsSubtype((PyTypeObject*)err, (PyTypeObject*)exc_type2);
+    }
+    return res;
+}
+#endif
+static int __Pyx_PyErr_GivenExceptionMatchesTuple(PyObject *exc_type, PyObject *tuple) {
+    Py_ssize_t i, n;
+    assert(PyExceptionClass_Check(exc_type));
+    n = PyTuple_GET_SIZE(tuple);
+#if PY_MAJOR_VERSION >= 3
+    for (i=0; i<n; i++) {
+        if (exc_type == PyTuple_GET_ITEM(tuple, i)) return 1;
+    }
+#endif
+    for (i=0; i<n; i++) {
+        PyObject *t = PyTuple_GET_ITEM(tuple, i);
+        #if PY_MAJOR_VERSION < 3
+        if (likely(exc_type == t)) return 1;
+        #endif
+        if (likely(PyExceptionClass_Check(t))) {
+            if (__Pyx_inner_PyErr_GivenExceptionMatches2(exc_type, NULL, t)) return 1;
+        } else {
+        }
+    }
+    return 0;
+}
+static CYTHON_INLINE int __Pyx_PyErr_GivenExceptionMatches(PyObject *err, PyObject* exc_type) {
+    if (likely(err == exc_type)) return 1;
+    if (likely(PyExceptionClass_Check(err))) {
+        if (likely(PyExceptionClass_Check(exc_type))) {
+            return __Pyx_inner_PyErr_GivenExceptionMatches2(err, NULL, exc_type);
+        } else if (likely(PyTuple_Check(exc_type))) {
+            return __Pyx_PyErr_GivenExceptionMatchesTuple(err, exc_type);
+        } else {
+        }
+    }
+    return PyErr_GivenExceptionMatches(err, exc_type);
+}
+static CYTHON_INLINE int __Pyx_PyErr_GivenExceptionMatches2(PyObject *err, PyObject *exc_type1, PyObject *exc_type2) {
+    assert(PyExceptionClass_Check(exc_type1));
+    assert(PyExceptionClass_Check(exc_type2));
+    if (likely(err == exc_type1 || err == exc_type2)) return 1;
+    if (likely(PyExceptionClass_Check(err))) {
+        return __Pyx_inner_PyErr_GivenExceptionMatches2(err, exc_type1, exc_type2);
+    }
+    return (PyErr_GivenExceptionMatches(err, exc_type1) || PyErr_GivenExceptionMatches(err, exc_type2));
+}
+#endif
+
+/* CheckBinaryVersion */
+  static int __Pyx_check_binary_version(void) {
+    char ctversion[5];
+    int same=1, i, found_dot;
+    const char* rt_from_call = Py_GetVersion();
+    PyOS_snprintf(ctversion, 5, "%d.%d", PY_MAJOR_VERSION, PY_MINOR_VERSION);
+    found_dot = 0;
+    for (i = 0; i < 4; i++) {
+        if (!ctversion[i]) {
+            same = (rt_from_call[i] < '0' || rt_from_call[i] > '9');
+            break;
+        }
+        if (rt_from_call[i] != ctversion[i]) {
+            same = 0;
+            break;
+        }
+    }
+    if (!same) {
+        char rtversion[5] = {'\0'};
+        char message[200];
+        for (i=0; i<4; ++i) {
+            if (rt_from_call[i] == '.') {
+                if (found_dot) break;
+                found_dot = 1;
+            } else if (rt_from_call[i] < '0' || rt_from_call[i] > '9') {
+                break;
+            }
+            rtversion[i] = rt_from_call[i];
+        }
+        PyOS_snprintf(message, sizeof(message),
+                      "compiletime version %s of module '%.100s' "
+                      "does not match runtime version %s",
+                      ctversion, __Pyx_MODULE_NAME, rtversion);
+        return PyErr_WarnEx(NULL, message, 1);
+    }
+    return 0;
+}
+
+/* InitStrings */
+  static int __Pyx_InitStrings(__Pyx_StringTabEntry *t) {
+    while (t->p) {
+        #if PY_MAJOR_VERSION < 3
+        if (t->is_unicode) {
+            *t->p = PyUnicode_DecodeUTF8(t->s, t->n - 1, NULL);
+        } else if (t->intern) {
+            *t->p = PyString_InternFromString(t->s);
+        } else {
+            *t->p = PyString_FromStringAndSize(t->s, t->n - 1);
+        }
+        #else
+        if (t->is_unicode | t->is_str) {
+            if (t->intern) {
+                *t->p = PyUnicode_InternFromString(t->s);
+            } else if (t->encoding) {
+                *t->p = PyUnicode_Decode(t->s, t->n - 1, t->encoding, NULL);
+            } else {
+                *t->p = PyUnicode_FromStringAndSize(t->s, t->n - 1);
+            }
+        } else {
+            *t->p = PyBytes_FromStringAndSize(t->s, t->n - 1);
+        }
+        #endif
+        if (!*t->p)
+            return -1;
+        if (PyObject_Hash(*t->p) == -1)
+            return -1;
+        ++t;
+    }
+    return 0;
+}
+
+static CYTHON_INLINE PyObject* __Pyx_PyUnicode_FromString(const char* c_str) {
+    return __Pyx_PyUnicode_FromStringAndSize(c_str, (Py_ssize_t)strlen(c_str));
+}
+static CYTHON_INLINE const char* __Pyx_PyObject_AsString(PyObject* o) {
+    Py_ssize_t ignore;
+    return __Pyx_PyObject_AsStringAndSize(o, &ignore);
+}
+#if __PYX_DEFAULT_STRING_ENCODING_IS_ASCII || __PYX_DEFAULT_STRING_ENCODING_IS_DEFAULT
+#if !CYTHON_PEP393_ENABLED
+static const char* __Pyx_PyUnicode_AsStringAndSize(PyObject* o, Py_ssize_t *length) {
+    char* defenc_c;
+    PyObject* defenc = _PyUnicode_AsDefaultEncodedString(o, NULL);
+    if (!defenc) return NULL;
+    defenc_c = PyBytes_AS_STRING(defenc);
+#if __PYX_DEFAULT_STRING_ENCODING_IS_ASCII
+    {
+        char* end = defenc_c + PyBytes_GET_SIZE(defenc);
+        char* c;
+        for (c = defenc_c; c < end; c++) {
+            if ((unsigned char) (*c) >= 128) {
+                PyUnicode_AsASCIIString(o);
+                return NULL;
+            }
+        }
+    }
+#endif
+    *length = PyBytes_GET_SIZE(defenc);
+    return defenc_c;
+}
+#else
+static CYTHON_INLINE const char* __Pyx_PyUnicode_AsStringAndSize(PyObject* o, Py_ssize_t *length) {
+    if (unlikely(__Pyx_PyUnicode_READY(o) == -1)) return NULL;
+#if __PYX_DEFAULT_STRING_ENCODING_IS_ASCII
+    if (likely(PyUnicode_IS_ASCII(o))) {
+        *length = PyUnicode_GET_LENGTH(o);
+        return PyUnicode_AsUTF8(o);
+    } else {
+        PyUnicode_AsASCIIString(o);
+        return NULL;
+    }
+#else
+    return PyUnicode_AsUTF8AndSize(o, length);
+#endif
+}
+#endif
+#endif
+static CYTHON_INLINE const char* __Pyx_PyObject_AsStringAndSize(PyObject* o, Py_ssize_t *length) {
+#if __PYX_DEFAULT_STRING_ENCODING_IS_ASCII || __PYX_DEFAULT_STRING_ENCODING_IS_DEFAULT
+    if (
+#if PY_MAJOR_VERSION < 3 && __PYX_DEFAULT_STRING_ENCODING_IS_ASCII
+            __Pyx_sys_getdefaultencoding_not_ascii &&
+#endif
+            PyUnicode_Check(o)) {
+        return __Pyx_PyUnicode_AsStringAndSize(o, length);
+    } else
+#endif
+#if (!CYTHON_COMPILING_IN_PYPY) || (defined(PyByteArray_AS_STRING) && defined(PyByteArray_GET_SIZE))
+    if (PyByteArray_Check(o)) {
+        *length = PyByteArray_GET_SIZE(o);
+        return PyByteArray_AS_STRING(o);
+    } else
+#endif
+    {
+        char* result;
+        int r = PyBytes_AsStringAndSize(o, &result, length);
+        if (unlikely(r < 0)) {
+            return NULL;
+        } else {
+            return result;
+        }
+    }
+}
+static CYTHON_INLINE int __Pyx_PyObject_IsTrue(PyObject* x) {
+   int is_true = x == Py_True;
+   if (is_true | (x == Py_False) | (x == Py_None)) return is_true;
+   else return PyObject_IsTrue(x);
+}
+static CYTHON_INLINE int __Pyx_PyObject_IsTrueAndDecref(PyObject* x) {
+    int retval;
+    if (unlikely(!x)) return -1;
+    retval = __Pyx_PyObject_IsTrue(x);
+    Py_DECREF(x);
+    return retval;
+}
+static PyObject* __Pyx_PyNumber_IntOrLongWrongResultType(PyObject* result, const char* type_name) {
+#if PY_MAJOR_VERSION >= 3
+    if (PyLong_Check(result)) {
+        if (PyErr_WarnFormat(PyExc_DeprecationWarning, 1,
+                "__int__ returned non-int (type %.200s).  "
+                "The ability to return an instance of a strict subclass of int "
+                "is deprecated, and may be removed in a future version of Python.",
+                Py_TYPE(result)->tp_name)) {
+            Py_DECREF(result);
+            return NULL;
+        }
+        return result;
+    }
+#endif
+    PyErr_Format(PyExc_TypeError,
+                 "__%.4s__ returned non-%.4s (type %.200s)",
+                 type_name, type_name, Py_TYPE(result)->tp_name);
+    Py_DECREF(result);
+    return NULL;
+}
+static CYTHON_INLINE PyObject* __Pyx_PyNumber_IntOrLong(PyObject* x) {
+#if CYTHON_USE_TYPE_SLOTS
+  PyNumberMethods *m;
+#endif
+  const char *name = NULL;
+  PyObject *res = NULL;
+#if PY_MAJOR_VERSION < 3
+  if (likely(PyInt_Check(x) || PyLong_Check(x)))
+#else
+  if (likely(PyLong_Check(x)))
+#endif
+    return __Pyx_NewRef(x);
+#if CYTHON_USE_TYPE_SLOTS
+  m = Py_TYPE(x)->tp_as_number;
+  #if PY_MAJOR_VERSION < 3
+  if (m && m->nb_int) {
+    name = "int";
+    res = m->nb_int(x);
+  }
+  else if (m && m->nb_long) {
+    name = "long";
+    res = m->nb_long(x);
+  }
+  #else
+  if (likely(m && m->nb_int)) {
+    name = "int";
+    res = m->nb_int(x);
+  }
+  #endif
+#else
+  if (!PyBytes_CheckExact(x) && !PyUnicode_CheckExact(x)) {
+    res = PyNumber_Int(x);
+  }
+#endif
+  if (likely(res)) {
+#if PY_MAJOR_VERSION < 3
+    if (unlikely(!PyInt_Check(res) && !PyLong_Check(res))) {
+#else
+    if (unlikely(!PyLong_CheckExact(res))) {
+#endif
+        return __Pyx_PyNumber_IntOrLongWrongResultType(res, name);
+    }
+  }
+  else if (!PyErr_Occurred()) {
+    PyErr_SetString(PyExc_TypeError,
+                    "an integer is required");
+  }
+  return res;
+}
+static CYTHON_INLINE Py_ssize_t __Pyx_PyIndex_AsSsize_t(PyObject* b) {
+  Py_ssize_t ival;
+  PyObject *x;
+#if PY_MAJOR_VERSION < 3
+  if (likely(PyInt_CheckExact(b))) {
+    if (sizeof(Py_ssize_t) >= sizeof(long))
+        return PyInt_AS_LONG(b);
+    else
+        return PyInt_AsSsize_t(b);
+  }
+#endif
+  if (likely(PyLong_CheckExact(b))) {
+    #if CYTHON_USE_PYLONG_INTERNALS
+    const digit* digits = ((PyLongObject*)b)->ob_digit;
+    const Py_ssize_t size = Py_SIZE(b);
+    if (likely(__Pyx_sst_abs(size) <= 1)) {
+        ival = likely(size) ? digits[0] : 0;
+        if (size == -1) ival = -ival;
+        return ival;
+    } else {
+      switch (size) {
+         case 2:
+           if (8 * sizeof(Py_ssize_t) > 2 * PyLong_SHIFT) {
+             return (Py_ssize_t) (((((size_t)digits[1]) << PyLong_SHIFT) | (size_t)digits[0]));
+           }
+           break;
+         case -2:
+           if (8 * sizeof(Py_ssize_t) > 2 * PyLong_SHIFT) {
+             return -(Py_ssize_t) (((((size_t)digits[1]) << PyLong_SHIFT) | (size_t)digits[0]));
+           }
+           break;
+         case 3:
+           if (8 * sizeof(Py_ssize_t) > 3 * PyLong_SHIFT) {
+             return (Py_ssize_t) (((((((size_t)digits[2]) << PyLong_SHIFT) | (size_t)digits[1]) << PyLong_SHIFT) | (size_t)digits[0]));
+           }
+           break;
+         case -3:
+           if (8 * sizeof(Py_ssize_t) > 3 * PyLong_SHIFT) {
+             return -(Py_ssize_t) (((((((size_t)digits[2]) << PyLong_SHIFT) | (size_t)digits[1]) << PyLong_SHIFT) | (size_t)digits[0]));
+           }
+           break;
+         case 4:
+           if (8 * sizeof(Py_ssize_t) > 4 * PyLong_SHIFT) {
+             return (Py_ssize_t) (((((((((size_t)digits[3]) << PyLong_SHIFT) | (size_t)digits[2]) << PyLong_SHIFT) | (size_t)digits[1]) << PyLong_SHIFT) | (size_t)digits[0]));
+           }
+           break;
+         case -4:
+           if (8 * sizeof(Py_ssize_t) > 4 * PyLong_SHIFT) {
+             return -(Py_ssize_t) (((((((((size_t)digits[3]) << PyLong_SHIFT) | (size_t)digits[2]) << PyLong_SHIFT) | (size_t)digits[1]) << PyLong_SHIFT) | (size_t)digits[0]));
+           }
+           break;
+      }
+    }
+    #endif
+    return PyLong_AsSsize_t(b);
+  }
+  x = PyNumber_Index(b);
+  if (!x) return -1;
+  ival = PyInt_AsSsize_t(x);
+  Py_DECREF(x);
+  return ival;
+}
+static CYTHON_INLINE Py_hash_t __Pyx_PyIndex_AsHash_t(PyObject* o) {
+  if (sizeof(Py_hash_t) == sizeof(Py_ssize_t)) {
+    return (Py_hash_t) __Pyx_PyIndex_AsSsize_t(o);
+#if PY_MAJOR_VERSION < 3
+  } else if (likely(PyInt_CheckExact(o))) {
+    return PyInt_AS_LONG(o);
+#endif
+  } else {
+    Py_ssize_t ival;
+    PyObject *x;
+    x = PyNumber_Index(o);
+    if (!x) return -1;
+    ival = PyInt_AsLong(x);
+    Py_DECREF(x);
+    return ival;
+  }
+}
+static CYTHON_INLINE PyObject * __Pyx_PyBool_FromLong(long b) {
+  return b ? __Pyx_NewRef(Py_True) : __Pyx_NewRef(Py_False);
+}
+static CYTHON_INLINE PyObject * __Pyx_PyInt_FromSize_t(size_t ival) {
+    return PyInt_FromSize_t(ival);
+}
+
+
+#endif /* Py_PYTHON_H */
@@ -4,10 +4,24 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
 import numpy as np
 from scipy import optimize
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
 
 from .mytypes import doublenp
+from .solvers import solve_block_tridiag
+from .solvers import residual_block_tridiag
+from .solvers import block_tridiag_to_dense
+from .solvers import solve_sparse
+from .solvers import replace_row_sparse
+from .solvers import sparse_solmethods
+from .solvers import ilu_reusable
+from .solvers import solve_lstsq
+from .solvers import solve_lstsq_batch
+from .solvers import solve_lstsq_qr
+from .solvers import solve_null_lu
 
 
 class Approach(object):
@@ -24,15 +38,29 @@ class Approach(object):
         StateIndexingDM object.
     kern : array
         Kernel (Liouvillian) representing the master equation.
+        For sparse solution methods, like 'spsolve', 'gmres', 'bicgstab',
+        it is stored as scipy.sparse.csr_matrix.
     bvec : array
         Right hand side column vector for master equation.
         The entry funcp.norm_row is 1 representing normalization condition.
     kern_ext : array
         Same as kern, only with one additional row added.
+    kern_blocks : tuple
+        Kernel stored as lists of diagonal, lower, and upper blocks
+        of a block-tridiagonal matrix. Used with solmethod='block'.
+    ilu : scipy.sparse.linalg.SuperLU
+        Incomplete LU decomposition of kern_ilu, which is reused as a preconditioner
+        for iterative sparse methods when funcp.warmq=True.
+    kern_ilu : scipy.sparse.csc_matrix
+        Kernel, for which ilu was calculated.
     bvec_ext : array
         Same as bvec, only with one additional entry added.
     sol0 : array
         Least squares solution for the master equation.
+    residual : float
+        Norm of the kernel acting on the stationary state phi0, i.e., the residual of L(Phi0)=0.
+    cond : float
+        Estimate of the condition number of the kernel obtained by 'lsqr', 'qr', and 'lu' methods.
     phi0 : array
         Values of zeroth order density matrix elements.
     phi1 : array
@@ -54,6 +82,14 @@ class Approach(object):
         Factors used to calculate energy and heat currents in 1vN, Redfield approaches.
     tLba : array
         Jump operator matrix in many-body basis for Lindblad approach.
+    mulst_batch, tlst_batch, dlst_batch : array
+        Lead parameters for a batch of points used by solve_batch().
+    kern_batch : array
+        Stack of kernels for a batch of points.
+    phi0_batch, success_batch : array
+        Values of phi0 and success flags for a batch of points.
+    current_batch, energy_current_batch, heat_current_batch : array
+        npoints by nleads arrays of currents for a batch of points.
     """
 
     kerntype = 'not defined'
@@ -67,10 +103,19 @@ class Approach(object):
     def generate_kern(self):
         pass
 
+    @staticmethod
+    def generate_kern_block(self):
+        pass
+
     @staticmethod
     def generate_current(self):
         pass
 
+    # Functions for batched solution, which are defined by approaches supporting it
+    generate_fct_batch = None
+    generate_kern_batch = None
+    generate_current_batch = None
+
     @staticmethod
     def generate_vec(self):
         pass
@@ -94,13 +139,26 @@ class Approach(object):
         """Restart values of some variables."""
         self.kern, self.bvec, self.norm_vec = None, None, None
         self.kern_ext, self.bvec_ext = None, None
+        self.kern_blocks = None
+        self.ilu, self.kern_ilu = None, None
         self.sol0, self.phi0, self.phi1 = None, None, None
+        self.residual, self.cond = None, None
         self.current = None
         self.energy_current = None
         self.heat_current = None
         self.phi1fct, self.paulifct = None, None
         self.phi1fct_energy = None
         self.tLba = None
+        #
+        self.mulst_batch, self.tlst_batch, self.dlst_batch = None, None, None
+        self.kern_batch, self.phi0_batch, self.success_batch = None, None, None
+        self.current_batch, self.energy_current_batch, self.heat_current_batch = None, None, None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Incomplete LU decompositions cannot be pickled
+        state['ilu'], state['kern_ilu'] = None, None
+        return state
 
     def set_phi0_init(self):
         if self.kerntype in {'Pauli', 'pyPauli'}:
@@ -120,10 +178,40 @@ class Approach(object):
         # Determine the proper solution method
         if solmethod is None:
             solmethod = 'solve' if symq else 'lsqr'
-        if not symq and solmethod != 'lsqr' and solmethod != 'lsmr':
+        # The fallback from solmethod=block is kept local, so funcp.solmethod is not overwritten
+        fallbackq = False
+        if solmethod == 'block':
+            if self.kern_blocks is not None:
+                if self.solve_kern_block():
+                    return
+            else:
+                print("WARNING: Block-tridiagonal kernel is not available for " + self.kerntype +
+                      " approach. Using solmethod=solve.")
+            solmethod, fallbackq = 'solve', True
+        if solmethod in sparse_solmethods:
+            self.funcp.solmethod = solmethod
+            self.solve_kern_sparse()
+            return
+        if not symq and solmethod not in {'lsqr', 'lsmr', 'qr', 'lu'}:
             print("WARNING: Using solmethod=lsqr, because the kernel is not symmetric, symq=False.")
             solmethod = 'lsqr'
-        self.funcp.solmethod = solmethod
+        if not fallbackq:
+            self.funcp.solmethod = solmethod
+        self.cond = None
+
+        # The null vector method uses the kernel without the normalisation condition
+        if solmethod == 'lu':
+            try:
+                phi0, self.cond = solve_null_lu(self.kern, self.norm_vec)
+                self.sol0 = [phi0]
+                self.phi0 = phi0
+                self.success = True
+            except Exception as exept:
+                self.funcp.print_error(exept)
+                self.phi0 = np.zeros(self.kern.shape[1])
+                self.success = False
+            self.get_residual()
+            return
 
         # Replace one equation by the normalisation condition
         if symq:
@@ -139,24 +227,142 @@ class Approach(object):
             if solmethod == 'solve':
                 self.sol0 = [np.linalg.solve(kern, bvec)]
             elif solmethod == 'lsqr':
-                self.sol0 = np.linalg.lstsq(kern, bvec, rcond=-1)
+                phi0, self.cond = solve_lstsq(kern, bvec)
+                self.sol0 = [phi0]
+            elif solmethod == 'qr':
+                phi0, self.cond = solve_lstsq_qr(kern, bvec)
+                self.sol0 = [phi0]
 
             self.phi0 = self.sol0[0]
             self.success = True
         except Exception as exept:
             self.funcp.print_error(exept)
-            self.phi0 = np.zeros(self.si.ndm0r)
+            self.phi0 = np.zeros(self.kern.shape[1])
             self.success = False
 
         # Return back the replaced equation
         if symq:
             kern[norm_row] = replaced_eq
+        self.get_residual()
+
+    def get_residual(self):
+        """
+        Calculates the residual of the master equation L(Phi0)=0 for the found solution.
+
+        self.residual : float
+            (Modifies) Norm of the kernel acting on phi0.
+        """
+        if self.kern is None or self.phi0 is None:
+            self.residual = None
+        else:
+            self.residual = np.linalg.norm(self.kern.dot(self.phi0))
+
+    def solve_kern_sparse(self):
+        """Finds the stationary state using sparse LU decomposition or iterative methods."""
+        solmethod = self.funcp.solmethod
+        symq = self.funcp.symq
+        norm_row = self.funcp.norm_row
+        kern = self.kern if sparse.issparse(self.kern) else sparse.csr_matrix(self.kern)
+
+        try:
+            if symq:
+                kern = replace_row_sparse(kern, norm_row, self.norm_vec)
+                if self.funcp.warmq and solmethod != 'spsolve':
+                    phi0, info = self.solve_sparse_warm(kern, solmethod)
+                else:
+                    phi0, info = solve_sparse(kern, self.bvec, solmethod)
+                self.sol0 = [phi0]
+                self.success = (info == 0)
+            else:
+                self.funcp.print_warning(1, "WARNING: Using sparse least squares lsqr, because " +
+                                            "the kernel is not symmetric, symq=False. " +
+                                            "This warning will not be shown again.")
+                kern = replace_row_sparse(kern, kern.shape[0], self.norm_vec)
+                self.sol0 = sparse_linalg.lsqr(kern, self.bvec_ext, atol=0, btol=0, conlim=0)
+                self.success = True
+            self.phi0 = self.sol0[0]
+        except Exception as exept:
+            self.funcp.print_error(exept)
+            self.phi0 = np.zeros(kern.shape[1])
+            self.success = False
+        self.get_residual()
+
+    def solve_sparse_warm(self, kern, solmethod):
+        """
+        Solves the master equation using iterative methods, which are started from
+        the previous solution phi0. The incomplete LU preconditioner of the previous
+        kernel is reused if the kernel has changed little.
+
+        self.ilu : scipy.sparse.linalg.SuperLU
+            (Modifies) Incomplete LU decomposition used as a preconditioner.
+        self.kern_ilu : scipy.sparse.csc_matrix
+            (Modifies) Kernel, for which the incomplete LU decomposition was calculated.
+        """
+        kern = sparse.csc_matrix(kern)
+        x0 = self.get_phi0_warm(kern.shape[1])
+        if not ilu_reusable(kern, self.kern_ilu):
+            self.ilu, self.kern_ilu = None, None
+        if self.ilu is not None:
+            phi0, info = solve_sparse(kern, self.bvec, solmethod, x0=x0, ilu=self.ilu)
+            if info == 0:
+                return phi0, info
+        self.ilu, self.kern_ilu = sparse_linalg.spilu(kern), kern
+        return solve_sparse(kern, self.bvec, solmethod, x0=x0, ilu=self.ilu)
+
+    def get_phi0_warm(self, length):
+        """Returns the previous solution phi0 if it can be used as an initial guess."""
+        phi0 = self.phi0
+        if phi0 is None or len(phi0) != length or not np.all(np.isfinite(phi0)) or not phi0.any():
+            return None
+        return np.array(phi0, dtype=doublenp)
+
+    def get_sparseq(self):
+        """Checks if the kernel is generated as a sparse matrix."""
+        return self.funcp.solmethod in sparse_solmethods and not self.funcp.mfreeq
+
+    def solve_kern_block(self, rtol=1e-8):
+        """
+        Finds the stationary state using block-tridiagonal elimination of the kernel.
+        If a block is singular, for example, for a charge sector without outflow, or the relative
+        residual of the solution exceeds rtol, the dense kernel is made from the blocks
+        and has to be solved by solve_kern() instead.
+
+        self.kern : array
+            (Modifies) Dense kernel made from the blocks, when the elimination fails.
+
+        Returns
+        -------
+        bool
+            Indicates if the stationary state was found by the elimination.
+        """
+        diag, lower, upper = self.kern_blocks
+        self.residual, self.cond = None, None
+        try:
+            phi0 = solve_block_tridiag(diag, lower, upper, self.norm_vec)
+            residual = residual_block_tridiag(diag, lower, upper, phi0)
+            scale = max([np.max(np.abs(block)) for block in diag if block.size > 0] + [0])
+            if not residual <= rtol*scale*np.linalg.norm(phi0):
+                raise np.linalg.LinAlgError('Inaccurate block-tridiagonal solution')
+        except np.linalg.LinAlgError:
+            kern = block_tridiag_to_dense(diag, lower, upper)
+            self.kern_ext = np.zeros((kern.shape[0]+1, kern.shape[1]), dtype=doublenp)
+            self.kern_ext[0:-1] = kern
+            self.kern = self.kern_ext[0:-1]
+            return False
+        self.sol0 = [phi0]
+        self.phi0 = phi0
+        self.success = True
+        self.residual = residual
+        return True
 
     def solve_matrix_free(self):
         """Finds the stationary state using matrix free methods like broyden, krylov, etc."""
         solmethod = self.funcp.solmethod
         #
         phi0_init = self.funcp.phi0_init
+        if self.funcp.warmq:
+            phi0_warm = self.get_phi0_warm(len(self.set_phi0_init()))
+            phi0_init = phi0_init if phi0_warm is None else phi0_warm
         if phi0_init is None:
             self.funcp.print_warning(0, "WARNING: For mfreeq=True no phi0_init is specified. " +
                                      "Using phi0_init[0]=1.0 as a default. " +
@@ -174,6 +380,83 @@ class Approach(object):
             self.success = False
         self.funcp.solmethod = solmethod
 
+    def get_batchq(self):
+        """Checks if the approach supports batched solution for many lead parameters."""
+        return self.generate_kern_batch is not None
+
+    def solve_kern_batch(self):
+        """
+        Finds the stationary states for a stack of kernels using batched linear algebra.
+
+        self.phi0_batch : array
+            (Modifies) npoints by N array of stationary states.
+        self.success_batch : array
+            (Modifies) Flags indicating if the stationary state was found.
+        """
+        kern, norm_vec = self.kern_batch, self.norm_vec
+        (symq, norm_row) = (self.funcp.symq, self.funcp.norm_row)
+        npoints, length = kern.shape[0], kern.shape[1]
+        if symq:
+            kern = np.array(kern)
+            kern[:, norm_row] = norm_vec
+            bvec = np.zeros((npoints, length), dtype=doublenp)
+            bvec[:, norm_row] = 1
+        else:
+            kern = np.concatenate((kern, np.broadcast_to(norm_vec, (npoints, 1, length))), axis=1)
+            bvec = np.zeros((npoints, length+1), dtype=doublenp)
+            bvec[:, -1] = 1
+        self.phi0_batch = np.zeros((npoints, length), dtype=doublenp)
+        self.success_batch = np.ones(npoints, dtype=bool)
+        try:
+            if symq:
+                self.phi0_batch[:] = np.linalg.solve(kern, bvec)
+            else:
+                self.phi0_batch[:] = solve_lstsq_batch(kern, bvec)
+        except np.linalg.LinAlgError:
+            # Solve the points one by one to find which kernels are singular
+            for i in range(npoints):
+                try:
+                    if symq:
+                        self.phi0_batch[i] = np.linalg.solve(kern[i], bvec[i])
+                    else:
+                        self.phi0_batch[i] = solve_lstsq(kern[i], bvec[i])[0]
+                except np.linalg.LinAlgError as exept:
+                    self.funcp.print_error(exept)
+                    self.success_batch[i] = False
+
+    def solve_batch(self, mulst, tlst, dlst, qdq=True, rotateq=True):
+        """
+        Solves the master equation for a batch of lead parameters with the same quantum dot
+        and tunneling amplitudes. The factors, kernels, and currents are calculated as stacked
+        arrays and the kernels are solved by batched linear algebra, see solve_kern_batch.
+
+        Parameters
+        ----------
+        mulst, tlst : array
+            npoints by nleads arrays of chemical potentials and temperatures.
+        dlst : array
+            npoints by nleads by 2 array of bandwidths.
+        qdq : bool
+            Diagonalise many-body quantum dot Hamiltonian
+            and express the lead matrix Tba in the eigenbasis.
+        rotateq : bool
+            Rotate the many-body tunneling matrix Tba.
+        """
+        if not self.get_batchq():
+            raise NotImplementedError('Batched solution is not implemented for ' + self.kerntype + ' approach.')
+        if qdq:
+            self.qd.diagonalise()
+            if rotateq:
+                self.leads.rotate(self.qd.vecslst)
+        #
+        self.mulst_batch = np.asarray(mulst, dtype=doublenp)
+        self.tlst_batch = np.asarray(tlst, dtype=doublenp)
+        self.dlst_batch = np.asarray(dlst, dtype=doublenp)
+        self.generate_fct_batch(self, self.mulst_batch, self.tlst_batch, self.dlst_batch)
+        self.generate_kern_batch(self)
+        self.solve_kern_batch()
+        self.generate_current_batch(self)
+
     def solve(self, qdq=True, rotateq=True, masterq=True, currentq=True, *args, **kwargs):
         """
         Solves the master equation.
@@ -199,6 +482,11 @@ class Approach(object):
             self.generate_fct(self)
             if self.funcp.mfreeq:
                 self.solve_matrix_free()
+            elif self.funcp.solmethod == 'block':
+                self.generate_kern_block(self)
+                if self.kern_blocks is None:
+                    self.generate_kern(self)
+                self.solve_kern()
             else:
                 self.generate_kern(self)
                 self.solve_kern()
@@ -208,6 +496,10 @@ class Approach(object):
 
 class ApproachElPh(Approach):
 
+    def get_sparseq(self):
+        # Electron-phonon kernels are added to dense tunneling kernels
+        return False
+
     @staticmethod
     def generate_fct_elph(self):
         pass
@@ -244,15 +536,30 @@ class ApproachElPh(Approach):
 class Iterations2vN(object):
     """
     Class for storing some properties of the system after 2vN iteration.
+
+    Attributes
+    ----------
+    dcurrent, dphi0 : float
+        Norms of the changes of current and phi0 compared to the previous iteration.
+        For the first iteration they are equal to infinity.
+    dphi1k : float
+        Norm of the last update phi1k_delta of Phi[1](k).
     """
 
-    def __init__(self, appr):
+    def __init__(self, appr, prev=None):
         self.niter = appr.niter
         self.phi0 = appr.phi0
         self.phi1 = appr.phi1
         self.current = appr.current
         self.energy_current = appr.energy_current
         self.heat_current = appr.heat_current
+        #
+        self.dphi1k = np.linalg.norm(appr.phi1k_delta)
+        if prev is None:
+            self.dcurrent, self.dphi0 = np.inf, np.inf
+        else:
+            self.dcurrent = np.linalg.norm(self.current - prev.current)
+            self.dphi0 = np.linalg.norm(self.phi0 - prev.phi0)
 
 
 class ApproachBase2vN(Approach):
@@ -284,14 +591,28 @@ class ApproachBase2vN(Approach):
     hphi1k_delta : array
         Numpy array with dimensions (len(Ek_grid_ext), nleads, ndm1, ndm0)
         Hilbert transform of phi1k_delta.
-    kern1k_inv : array
-        Numpy array with dimensions (len(Ek_grid), nleads, ndm1, ndm1)
-        corresponding to inverse of energy resolved local kernel for Phi[1](k).
+    kern1k_lu : tuple
+        Tuple (lu, piv) of block LU factors of energy resolved local kernel for Phi[1](k)
+        with dimensions (len(Ek_grid), size) and (len(Ek_grid), ndm1), see neumann2.get_kern1_blocks.
     fkp, fkm : array
         nleads by len(Ek_grid_ext) numpy array containing
         Fermi function (fkp) and 1-Fermi (fkm) values on the grid Ek_grid_ext.
     hfkp, hfkm : array
         Hilbert transform of fkp, fkm.
+    anderson_hist : list
+        History of Anderson mixing containing lists [phi1k, residual, iterated residual].
+    anderson_coeffs : array
+        Coefficients of the last Anderson mixing.
+    converged : bool
+        For solve(tol=...) indicates if the iterations have converged.
+    last_iter : Iterations2vN
+        Iterations2vN object of the last iteration, which is kept also when iters is bounded.
+    memory, peak_memory : int
+        Number of bytes in the energy resolved arrays after the last iteration
+        and the maximal number after any of the iterations.
+    phi1k_init : array
+        Initial guess of phi1k for the first iteration. For funcp.warmq=True it is set by solve()
+        to phi1k of the previous calculation interpolated on the new Ek_grid.
     """
 
     kerntype = 'not defined'
@@ -336,17 +657,26 @@ class ApproachBase2vN(Approach):
             raise TypeError('The state indexing class for 2vN approach has to be StateIndexingDMc')
 
     def make_Ek_grid(self):
-        """Make an energy grid on which 2vN equations are solved. """
+        """
+        Make an energy grid on which 2vN equations are solved. For funcp.grid_2vN='uniform'
+        the grid is equidistant and for funcp.grid_2vN='adaptive' it is generated by make_Ek_grid_adaptive.
+        """
         if self.funcp.kpnt is None:
             raise ValueError('kpnt needs to be specified.')
+        if self.funcp.grid_2vN not in ('uniform', 'adaptive'):
+            raise ValueError("grid_2vN has to be 'uniform' or 'adaptive'.")
         if self.si.nleads > 0:
             dmin = np.min(self.leads.dlst)
             dmax = np.max(self.leads.dlst)
-            Ek_grid, kpnt = self.Ek_grid, self.funcp.kpnt
-            if Ek_grid[0] != dmin or Ek_grid[-1] != dmax or Ek_grid.shape[0] != kpnt:
+            kpnt = self.funcp.kpnt
+            if self.funcp.grid_2vN == 'adaptive':
+                Ek_grid = self.make_Ek_grid_adaptive(dmin, dmax, kpnt)
+            else:
+                Ek_grid = np.linspace(dmin, dmax, kpnt)
+            if not np.array_equal(self.Ek_grid, Ek_grid):
                 self.funcp.dmin = dmin
                 self.funcp.dmax = dmax
-                self.Ek_grid = np.linspace(dmin, dmax, kpnt)
+                self.Ek_grid = Ek_grid
                 #
                 if self.niter != -1:
                     print("WARNING: Ek_grid has changed. Restarting the calculation.")
@@ -357,10 +687,70 @@ class ApproachBase2vN(Approach):
                     print("WARNING: The bandwidth and Ek_grid for all leads will be the same: from " +
                           "dmin=" + str(dmin) + " to dmax=" + str(dmax) + ".")
 
+    def make_Ek_grid_adaptive(self, dmin, dmax, kpnt):
+        """
+        Make a non-equidistant energy grid, which is concentrated around the transition
+        energies E[c]-E[b] of the quantum dot and around the chemical potentials of the leads.
+
+        The density of the grid points is a sum of a constant, which contains the fraction
+        funcp.grid_fct of the points, and of Lorentzians centered at the resonances.
+        The width of a Lorentzian is given by the temperature of the leads and for a transition
+        also by its tunneling rate 2*pi*sum_l |Tba[l, b, c]|^2. The grid is found by inverting
+        the cumulative distribution of the density using bisection.
+
+        Parameters
+        ----------
+        dmin, dmax : float
+            Bandedges, which are the first and the last points of the grid.
+        kpnt : int
+            Number of grid points.
+
+        Returns
+        -------
+        array
+            Increasing grid of kpnt points from dmin to dmax.
+        """
+        (E, Tba, si) = (self.qd.Ea, self.leads.Tba, self.si)
+        (mulst, tlst) = (self.leads.mulst, self.leads.tlst)
+        centers, widths = list(mulst), list(tlst)
+        tmin = np.min(tlst)
+        for charge in range(si.ncharge-1):
+            for c in si.statesdm[charge+1]:
+                for b in si.statesdm[charge]:
+                    gamma = 2*np.pi*np.sum(np.abs(Tba[:, b, c])**2)
+                    centers.append(E[c]-E[b])
+                    widths.append(tmin+gamma)
+        centers = np.array(centers, dtype=doublenp)
+        widths = np.array(widths, dtype=doublenp)
+        inband = np.logical_and(centers > dmin, centers < dmax)
+        centers, widths = centers[inband], widths[inband]
+        fct = self.funcp.grid_fct
+        # Cumulative distribution of the grid points
+        amin, amax = np.arctan((dmin-centers)/widths), np.arctan((dmax-centers)/widths)
+
+        def cdf(x):
+            rez = (x-dmin)/(dmax-dmin)
+            if len(centers) > 0:
+                lor = (np.arctan((x[:, None]-centers)/widths) - amin)/(amax-amin)
+                rez = fct*rez + (1-fct)*np.mean(lor, axis=1)
+            return rez
+        target = np.linspace(0, 1, kpnt)
+        lo, hi = np.full(kpnt, dmin, dtype=doublenp), np.full(kpnt, dmax, dtype=doublenp)
+        for it in range(64):
+            mid = (lo+hi)/2
+            below = cdf(mid) < target
+            lo, hi = np.where(below, mid, lo), np.where(below, hi, mid)
+        Ek_grid = (lo+hi)/2
+        Ek_grid[0], Ek_grid[-1] = dmin, dmax
+        return Ek_grid
+
     def restart(self):
         """Restart values of some variables for new calculations."""
         self.kern, self.bvec = None, None
+        self.kern_blocks = None
+        self.ilu, self.kern_ilu = None, None
         self.sol0, self.phi0, self.phi1 = None, None, None
+        self.residual, self.cond = None, None
         self.current = None
         self.energy_current = None
         self.heat_current = None
@@ -369,29 +759,273 @@ class ApproachBase2vN(Approach):
         self.phi1k = None
         self.phi1k_delta = None
         self.hphi1k_delta = None
-        self.kern1k_inv = None
+        self.kern1k_lu = None
+        self.shift_tables = None
         self.phi1_phi0 = None
         self.e_phi1_phi0 = None
         #
+        self.anderson_hist = []
+        self.anderson_coeffs = None
+        self.converged = None
+        #
         self.iters = []
+        self.last_iter = None
+        self.memory, self.peak_memory = 0, 0
+        self.phi1k_init = None
+
+    def iteration(self, anderson=0):
+        """
+        Makes one iteration for solution of the 2vN integral equation.
 
-    def iteration(self):
-        """Makes one iteration for solution of the 2vN integral equation."""
+        Parameters
+        ----------
+        anderson : int
+            If anderson>1 the update of phi1k is obtained by Anderson (DIIS) mixing
+            of the last anderson iterations. Otherwise phi1k_delta is added to phi1k.
+        """
         self.iterate(self)
-        self.phi1k = self.phi1k_delta if self.phi1k is None else self.phi1k + self.phi1k_delta
+        if self.phi1k is None and self.phi1k_init is not None:
+            self.warm_start()
+        self.update_memory()
+        if anderson > 1 or self.anderson_hist:
+            # After mixing the plain iteration is continued using the residual of the mixing history
+            self.anderson_mixing(max(anderson, 1))
+        elif self.phi1k is None:
+            # The array phi1k_delta is replaced by a new one in the next iteration,
+            # so it can be accumulated in place
+            self.phi1k = self.phi1k_delta
+        else:
+            self.phi1k += self.phi1k_delta
         self.get_phi1_phi0(self)
         self.niter += 1
         self.kern_phi0(self)
         self.solve_kern()
         self.generate_current(self)
+        self.update_memory()
+        #
+        self.last_iter = Iterations2vN(self, self.last_iter)
+        iters_size = self.funcp.iters_size
+        if iters_size is None or iters_size > 0:
+            self.iters.append(self.last_iter)
+            if iters_size is not None:
+                del self.iters[0:-iters_size]
+
+    def warm_start(self):
+        """
+        Starts the iterations from the initial guess x0 = phi1k_init instead of the local
+        approximation L0, which is in phi1k_delta after the first call of iterate. The integral
+        equation is phi1k = L0 + A(phi1k), so phi1k is set to x0 and phi1k_delta to its residual
+        f(x0) = L0 + A(x0) - x0. Then the plain iteration adds f(x0) to phi1k and the next call
+        of iterate gives A(f(x0)), which is the residual of x0 + f(x0). The Anderson mixing
+        uses x0 and f(x0) as the first entry of the history.
+
+        self.phi1k : array
+            (Modifies) The initial guess x0.
+        self.phi1k_delta : array
+            (Modifies) Residual of the initial guess.
+        self.phi1k_init : array
+            (Modifies) Set to None.
+        """
+        (phi1k, kern0) = (self.phi1k_init, self.phi1k_delta)
+        self.phi1k_init = None
+        self.phi1k_delta = phi1k
+        self.iterate(self)
+        self.phi1k_delta += kern0 - phi1k
+        self.phi1k = phi1k
+
+    def interpolate_phi1k(self, Ek_grid, phi1k):
+        """
+        Linearly interpolates phi1k given on the grid Ek_grid on the current self.Ek_grid.
+        Outside of Ek_grid the values at the edges are used.
+
+        Parameters
+        ----------
+        Ek_grid : array
+            Energy grid of phi1k.
+        phi1k : array
+            Numpy array with dimensions (len(Ek_grid), nleads, ndm1, ndm0).
+
+        Returns
+        -------
+        array
+            Numpy array with dimensions (len(self.Ek_grid), nleads, ndm1, ndm0)
+            of the type funcp.mtype_2vN.
+        """
+        mtype = self.funcp.mtype_2vN
+        if np.array_equal(Ek_grid, self.Ek_grid):
+            return np.array(phi1k, dtype=mtype)
+        ind = np.clip(np.searchsorted(Ek_grid, self.Ek_grid), 1, len(Ek_grid)-1)
+        w = np.clip((self.Ek_grid-Ek_grid[ind-1])/(Ek_grid[ind]-Ek_grid[ind-1]), 0, 1)
+        w = w.reshape((-1,) + (1,)*(phi1k.ndim-1))
+        return np.asarray((1-w)*phi1k[ind-1] + w*phi1k[ind], dtype=mtype)
+
+    def get_memory(self):
+        """
+        Returns the number of bytes in the energy resolved arrays phi1k, phi1k_delta,
+        hphi1k_delta, kern1k_lu, fkp, fkm, hfkp, hfkm, in the history of Anderson mixing,
+        and in the matrix of Hilbert transform on the 'adaptive' grid.
+        Views are counted by the size of the underlying array.
+        """
+        arrays = [self.phi1k, self.phi1k_delta, self.hphi1k_delta, self.fkp, self.fkm, self.hfkp, self.hfkm]
+        if self.funcp.grid_2vN != 'uniform':
+            arrays.append(self.funcp.htransf.matrix)
+        if self.kern1k_lu is not None:
+            arrays.extend(self.kern1k_lu)
+        for h in self.anderson_hist:
+            arrays.extend(h)
+        bases = {}
+        for arr in arrays:
+            while isinstance(arr, np.ndarray) and isinstance(arr.base, np.ndarray):
+                arr = arr.base
+            if isinstance(arr, np.ndarray):
+                bases[id(arr)] = arr.nbytes
+        return sum(bases.values())
+
+    def update_memory(self):
+        """Updates memory and peak_memory using get_memory()."""
+        self.memory = self.get_memory()
+        self.peak_memory = max(self.peak_memory, self.memory)
+
+    # Arrays and parameters of funcp, which are stored in a checkpoint
+    checkpoint_arrays = ('Ek_grid', 'Ek_grid_ext', 'phi1k', 'phi1k_delta', 'fkp', 'fkm', 'hfkp', 'hfkm',
+                         'phi1_phi0', 'e_phi1_phi0', 'phi0', 'phi1', 'current', 'energy_current',
+                         'heat_current', 'anderson_coeffs')
+    checkpoint_funcp = ('kpnt', 'kpnt_left', 'kpnt_right', 'dmin', 'dmax', 'emin', 'emax',
+                        'ext_fct', 'grid_2vN', 'grid_fct')
+
+    def save_checkpoint(self, filename, compressq=True):
+        """
+        Saves the state of the 2vN iterations to a .npz file, from which the iterations can be
+        resumed using load_checkpoint and solve(restartq=False). The arrays are written one by one
+        without pickling. The file is first written to filename+'.tmp' and then renamed,
+        so an interrupted saving does not corrupt the previous checkpoint.
+
+        Parameters
+        ----------
+        filename : str
+            Name of the file.
+        compressq : bool
+            Compress the arrays.
+        """
+        state = dict(niter=self.niter, mtype=np.dtype(self.funcp.mtype_2vN).str,
+                     shape=(self.si.nleads, self.si.ndm1, self.si.ndm0), Ea=self.qd.Ea)
+        for name in self.checkpoint_arrays:
+            if getattr(self, name) is not None:
+                state[name] = getattr(self, name)
+        for name in self.checkpoint_funcp:
+            state['funcp_'+name] = getattr(self.funcp, name)
+        if self.kern1k_lu is not None:
+            state['kern1k_lu'], state['kern1k_piv'] = self.kern1k_lu
+        for i, h in enumerate(self.anderson_hist):
+            for j in range(3):
+                if h[j] is not None:
+                    state['anderson_hist_'+str(i)+'_'+str(j)] = h[j]
+        state['anderson_hist_len'] = len(self.anderson_hist)
+        if self.last_iter is not None:
+            state['last_iter'] = [self.last_iter.dcurrent, self.last_iter.dphi0]
         #
-        self.iters.append(Iterations2vN(self))
+        tmpname = filename+'.tmp'
+        with open(tmpname, 'wb') as f:
+            (np.savez_compressed if compressq else np.savez)(f, **state)
+        os.replace(tmpname, filename)
+
+    def load_checkpoint(self, filename):
+        """
+        Loads the state of the 2vN iterations saved by save_checkpoint. The calculation
+        is continued by solve(restartq=False), which gives the same results as if it was
+        not interrupted. Only the last iteration is put into iters. The quantum dot Hamiltonian
+        is diagonalised to check that the checkpoint belongs to the same system.
+
+        Parameters
+        ----------
+        filename : str
+            Name of the file.
+        """
+        self.restart()
+        self.qd.diagonalise()
+        with np.load(filename, allow_pickle=False) as data:
+            if tuple(data['shape']) != (self.si.nleads, self.si.ndm1, self.si.ndm0):
+                raise ValueError('The checkpoint ' + filename + ' does not match the state indexing.')
+            if self.qd.Ea.shape != data['Ea'].shape or not np.allclose(self.qd.Ea, data['Ea']):
+                print("WARNING: The energies of the quantum dot differ from the checkpoint " + filename + ".")
+            self.niter = int(data['niter'])
+            self.funcp.mtype_2vN = np.dtype(str(data['mtype'])).type
+            for name in self.checkpoint_funcp:
+                value = data['funcp_'+name][()]
+                setattr(self.funcp, name, value.item() if isinstance(value, np.generic) else value)
+            for name in self.checkpoint_arrays:
+                if name in data:
+                    setattr(self, name, data[name])
+            if 'kern1k_lu' in data:
+                self.kern1k_lu = (data['kern1k_lu'], data['kern1k_piv'])
+            for i in range(int(data['anderson_hist_len'])):
+                keys = ['anderson_hist_'+str(i)+'_'+str(j) for j in range(3)]
+                self.anderson_hist.append([data[key] if key in data else None for key in keys])
+            if 'last_iter' in data and self.phi0 is not None:
+                self.last_iter = Iterations2vN(self)
+                self.last_iter.dcurrent, self.last_iter.dphi0 = data['last_iter']
+                if self.funcp.iters_size is None or self.funcp.iters_size > 0:
+                    self.iters.append(self.last_iter)
+        self.update_memory()
+
+    def anderson_mixing(self, anderson):
+        """
+        Updates phi1k using Anderson (DIIS) mixing.
+
+        The integral equation has the form phi1k = L0 + A(phi1k), where A is a real linear map
+        evaluated by iterate. For an affine map the residual f(x) = L0 + A(x) - x of the mixed
+        iterate x = sum_j c_j*(x_j+f_j) with sum_j c_j = 1 is sum_j c_j*A(f_j). So only A(f_n)
+        of the newest residual is evaluated in each iteration. The real coefficients c_j minimise
+        the norm of the mixed residual. With a history of length one it is the plain iteration.
+
+        Parameters
+        ----------
+        anderson : int
+            Number of the stored iterations.
+
+        self.phi1k : array
+            (Modifies) Mixed Phi[1](k).
+        self.phi1k_delta : array
+            (Modifies) Residual of the previous phi1k, which is iterated in the next call of iterate.
+        self.anderson_hist : list
+            (Modifies) History of phi1k, residuals, and iterated residuals.
+        self.anderson_coeffs : array
+            (Modifies) Mixing coefficients.
+        """
+        hist = self.anderson_hist
+        if len(hist) == 0:
+            # Without history iterate gives the residual of phi1k, which is zero at the start
+            res = self.phi1k_delta
+        else:
+            hist[-1][2] = self.phi1k_delta
+            res = sum(c*h[2] for c, h in zip(self.anderson_coeffs, hist))
+        phi1k = np.zeros(res.shape, dtype=res.dtype) if self.phi1k is None else self.phi1k
+        hist.append([phi1k, res, None])
+        del hist[0:-anderson]
+        # Minimise the norm of the mixed residual with the constraint sum_j c_j = 1
+        n = len(hist)
+        gram = np.zeros((n+1, n+1), dtype=doublenp)
+        for i in range(n):
+            for j in range(i, n):
+                gram[i, j] = gram[j, i] = np.vdot(hist[i][1], hist[j][1]).real
+        gram[0:n, 0:n] /= max(np.max(np.diag(gram)), np.finfo(doublenp).tiny)
+        gram[n, 0:n] = gram[0:n, n] = 1
+        rhs = np.zeros(n+1, dtype=doublenp)
+        rhs[n] = 1
+        coeffs = np.linalg.lstsq(gram, rhs, rcond=None)[0][0:n]
+        #
+        self.anderson_coeffs = coeffs
+        self.phi1k = sum(c*(h[0]+h[1]) for c, h in zip(coeffs, hist))
+        self.phi1k_delta = res
 
     def solve(self,
               qdq=True, rotateq=True, masterq=True, restartq=True,
-              niter=None, func_iter=None, *args, **kwargs):
+              niter=None, func_iter=None, tol=None, maxiter=100, anderson=0,
+              checkpoint=None, checkpoint_step=10, multigrid=0, multigrid_niter=4, *args, **kwargs):
         """
-        Solves the 2vN approach integral equations iteratively.
+        Solves the 2vN approach integral equations iteratively. For funcp.warmq=True and
+        restartq=True the iterations start from phi1k of the previous calculation,
+        which is useful for parameter sweeps, see warm_start.
 
         Parameters
         ----------
@@ -410,8 +1044,34 @@ class ApproachBase2vN(Approach):
         func_iter : function
             User defined function which is performed after every iteration and
             takes Approach2vN object as an input.
+        tol : float
+            If tol is specified, instead of performing niter iterations, the iterations are
+            performed until the norms of the changes of current and phi0 compared to
+            the previous iteration are smaller than tol. The changes are recorded in iters.
+        maxiter : int
+            Maximal number of iterations when tol is specified.
+        anderson : int
+            Number of the last iterations used in Anderson (DIIS) mixing of phi1k.
+            For anderson<=1 plain iterations are performed.
+        checkpoint : str
+            If given, the state is saved to this file using save_checkpoint
+            after every checkpoint_step iterations and after the last iteration.
+        checkpoint_step : int
+            Number of iterations between the checkpoints.
+        multigrid : int
+            Number of coarser grids with kpnt/2**multigrid, ..., kpnt/4, kpnt/2 points, on which
+            the first iterations are performed. The phi1k from a coarse grid is interpolated on
+            the next finer grid as the initial guess, see warm_start, so on the finest grid fewer
+            iterations are needed. Grids with less than 16 points are skipped. The checkpoints
+            are saved only on the finest grid. Used only for restartq=True.
+        multigrid_niter : int
+            Number of iterations on each coarse grid. The coarse grids are not iterated to tol,
+            because the equations on an under-resolved grid can converge slowly.
         """
+        warm = None
         if restartq:
+            if self.funcp.warmq and self.phi1k is not None:
+                warm = (self.Ek_grid, self.phi1k)
             self.restart()
         if qdq:
             self.qd.diagonalise()
@@ -420,11 +1080,57 @@ class ApproachBase2vN(Approach):
         #
         if masterq:
             # Exception
-            if niter is None:
-                raise ValueError('Number of iterations niter needs to be specified')
-            self.make_Ek_grid()
-            #
-            for it in range(niter):
-                self.iteration()
-                if func_iter is not None:
-                    func_iter(self)
+            if niter is None and tol is None:
+                raise ValueError('Number of iterations niter or tolerance tol needs to be specified')
+            kpnt = self.funcp.kpnt
+            try:
+                # Iterations on the coarse grids, which give the initial guess for the finer grids
+                for level in range(multigrid if restartq else 0, 0, -1):
+                    if kpnt is None or kpnt >> level < 16:
+                        continue
+                    self.funcp.kpnt = kpnt >> level
+                    warm = self.iterate_grid(warm, multigrid_niter, func_iter, None, maxiter, anderson)
+                    self.restart()
+            finally:
+                self.funcp.kpnt = kpnt
+            self.iterate_grid(warm, niter, func_iter, tol, maxiter, anderson, checkpoint, checkpoint_step)
+
+    def iterate_grid(self, warm, niter, func_iter, tol, maxiter, anderson,
+                     checkpoint=None, checkpoint_step=10):
+        """
+        Makes Ek_grid and performs the iterations of solve() on it.
+
+        Parameters
+        ----------
+        warm : tuple
+            If not None, the iterations start from phi1k of the tuple (Ek_grid, phi1k),
+            which is interpolated on the new Ek_grid.
+
+        For the other parameters see solve().
+
+        Returns
+        -------
+        tuple
+            Tuple (Ek_grid, phi1k) after the iterations.
+        """
+        self.make_Ek_grid()
+        if warm is not None and warm[1].shape[1:] == (self.si.nleads, self.si.ndm1, self.si.ndm0):
+            self.phi1k_init = self.interpolate_phi1k(*warm)
+        #
+        for it in range(niter if tol is None else maxiter):
+            self.iteration(anderson)
+            if func_iter is not None:
+                func_iter(self)
+            if checkpoint is not None and (it+1) % checkpoint_step == 0:
+                self.save_checkpoint(checkpoint)
+            if tol is not None and self.last_iter.dcurrent < tol and self.last_iter.dphi0 < tol:
+                self.converged = True
+                break
+        else:
+            if tol is not None:
+                self.converged = False
+                print("WARNING: 2vN iterations did not converge to tol=" + str(tol) +
+                      " in maxiter=" + str(maxiter) + " iterations.")
+        if checkpoint is not None and self.niter >= 0:
+            self.save_checkpoint(checkpoint)
+        return self.Ek_grid, self.phi1k
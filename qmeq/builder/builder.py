@@ -65,6 +65,19 @@ class Builder(BuilderBase):
         Possible value is 'spin'.
     kpnt : int
         Number of energy grid points on which 2vN approach equations are solved.
+    nthreads : int
+        Number of OpenMP threads used in the iterations of '2vN' approach
+        and number of workers used by its FFT Hilbert transforms.
+    mtype_2vN : complex or numpy.complex64
+        Type for the energy resolved arrays of '2vN' approach.
+    iters_size : int
+        Maximal number of iterations kept in iters for '2vN' approach (None for all).
+    grid_2vN : str
+        Energy grid of '2vN' approach, 'uniform' or 'adaptive' (concentrated around the resonances).
+        The 'adaptive' grid uses a dense Hilbert transform matrix with O(kpnt**2) memory and
+        cost per iteration, so it is meant for grids with at most a few thousand points.
+    grid_fct : float
+        Fraction of the points of the 'adaptive' grid, which are distributed uniformly.
     kerntype : string, Approach class
         String describing what master equation approach to use.
         For Approach class the possible values are 'Pauli', '1vN', 'Redfield', 'Lindblad', \
@@ -82,12 +95,20 @@ class Builder(BuilderBase):
         String specifying the solution method of the equation L(Phi0)=0.
         The possible values are matrix inversion 'solve' and least squares 'lsqr'.
         Method 'solve' works only when symq=True.
+        Least squares can also be found using QR decomposition with column pivoting 'qr',
+        and the stationary state as the null vector of the kernel using LU decomposition 'lu'.
+        Both fall back to singular value decomposition based 'lsqr' for ill-conditioned kernels.
+        For Pauli approach the kernel can be solved by block-tridiagonal
+        elimination over the charge states using 'block'.
+        The kernel is generated as a sparse matrix for sparse LU decomposition 'spsolve'
+        and for iterative methods 'gmres', 'bicgstab' preconditioned with incomplete LU.
         For matrix free methods (used when mfreeq=True) the possible values are
         'krylov', 'broyden', etc.
     itype : int
         Type of integral for first order approach calculations.
         itype=0: the principal parts are evaluated using Fortran integration package QUADPACK \
-                 routine dqawc through SciPy.
+                 routine dqawc through SciPy. For many transitions the integrals are obtained \
+                 from the wide band expression or from cached tables, see pv_tableq.
         itype=1: the principal parts are kept, but approximated by digamma function valid for \
                  large bandwidth D.
         itype=2: the principal parts are neglected.
@@ -95,10 +116,19 @@ class Builder(BuilderBase):
     dqawc_limit : int
         For itype=0 dqawc_limit determines the maximum number of sub-intervals
         in the partition of the given integration interval.
+    pv_tableq : bool
+        If pv_tableq=False the principal value integrals for itype=0 are always evaluated
+        by dqawc for each transition instead of using the wide band expression or cached tables.
     mfreeq : bool
         If mfreeq=True the matrix free solution method is used for first order methods.
     phi0_init : array
         For mfreeq=True the initial value of zeroth order density matrix elements.
+    warmq : bool
+        If warmq=True the solution phi0 of the previous calculation is used as the initial guess
+        for matrix free and iterative sparse methods ('gmres', 'bicgstab'). For the iterative
+        methods also the incomplete LU preconditioner is reused while the kernel changes little.
+        For '2vN' approach the iterations start from phi1k of the previous calculation.
+        This is useful for parameter sweeps.
     mtype_qd : float or complex
         Type for the many-body quantum dot Hamiltonian matrix.
     mtype_leads : float or complex
@@ -129,6 +159,9 @@ class Builder(BuilderBase):
         FunctionProperties object.
     Ea : array
         nmany by 1 array containing many-body Hamiltonian eigenvalues.
+    vgate : float
+        Gate voltage adding the term -vgate*N to the quantum dot Hamiltonian.
+        Changing vgate shifts Ea analytically without diagonalisation.
     Tba : array
         nleads by nmany by nmany array, which contains many-body tunneling amplitude matrix,
         which is used in calculations.
@@ -149,6 +182,9 @@ class Builder(BuilderBase):
         Number of iterations performed when solving integral equation for 2vN approach.
     iters : Iterations2vN
         Iterations2vN object, which is present just for 2vN approach.
+        It also records the changes of current and phi0 after each iteration.
+    converged : bool
+        For 2vN approach solved with solve(tol=...) indicates if the iterations have converged.
     """
 
     @classmethod
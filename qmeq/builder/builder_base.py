@@ -25,6 +25,10 @@ from .various import remove_coherences
 from .various import remove_states
 from .various import use_all_states
 
+from .sweep import sweep
+from .sweep import batch_sweep
+from .sweep import stability_diagram
+
 from .validation import validate_kerntype
 from .validation import validate_itype
 from .validation import validate_indexing
@@ -66,11 +70,14 @@ attribute_map = dict(
     # Approach
     solve='appr', current='appr', energy_current='appr',
     heat_current='appr', phi0='appr', phi1='appr', niter='appr',
-    iters='appr', kern='appr', success='appr',
+    iters='appr', kern='appr', success='appr', converged='appr',
+    save_checkpoint='appr', load_checkpoint='appr',
     # FunctionProperties
     kpnt='funcp', symq='funcp', norm_row='funcp', solmethod='funcp',
     itype='funcp', dqawc_limit='funcp',
-    mfreeq='funcp', phi0_init='funcp',
+    mfreeq='funcp', phi0_init='funcp', warmq='funcp', pv_tableq='funcp',
+    nthreads='funcp', mtype_2vN='funcp', iters_size='funcp',
+    grid_2vN='funcp', grid_fct='funcp',
     )
 
 
@@ -94,7 +101,7 @@ class BuilderBase(object):
                  nleads=0, tleads={}, mulst={}, tlst={}, dband={},
                  indexing=None, kpnt=None,
                  kerntype='Pauli', symq=True, norm_row=0, solmethod=None,
-                 itype=0, dqawc_limit=10000, mfreeq=False, phi0_init=None,
+                 itype=0, dqawc_limit=10000, mfreeq=False, phi0_init=None, warmq=False,
                  mtype_qd=complex, mtype_leads=complex,
                  symmetry=None, herm_hs=True, herm_c=False, m_less_n=True):
 
@@ -132,7 +139,7 @@ class BuilderBase(object):
         data = self.data
         self.funcp = FunctionProperties(symq=data.symq, norm_row=data.norm_row, solmethod=data.solmethod,
                                         itype=data.itype, dqawc_limit=data.dqawc_limit,
-                                        mfreeq=data.mfreeq, phi0_init=data.phi0_init,
+                                        mfreeq=data.mfreeq, phi0_init=data.phi0_init, warmq=data.warmq,
                                         mtype_qd=data.mtype_qd, mtype_leads=data.mtype_leads,
                                         kpnt=data.kpnt, dband=data.dband)
 
@@ -162,6 +169,16 @@ class BuilderBase(object):
             sub_class = getattr(self, attribute_map[item])
             setattr(sub_class, item, value)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Module dictionaries cannot be pickled
+        state.pop('globals', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_set_globals()
+
     def change_si(self):
         si = self.si
         icn = self.Approach.indexing_class_name
@@ -208,6 +225,14 @@ class BuilderBase(object):
         self.leads.change(dlst=value)
     dband = property(get_dband, set_dband)
 
+    # vgate
+    def get_vgate(self):
+        return self.qd.vgate
+
+    def set_vgate(self, value):
+        self.qd.set_gate(value)
+    vgate = property(get_vgate, set_vgate)
+
     def add(self, hsingle=None, coulomb=None, tleads=None, mulst=None, tlst=None, dlst=None):
         """
         Adds the values to the specified dictionaries and correspondingly redefines
@@ -297,6 +322,27 @@ class BuilderBase(object):
         """
         use_all_states(self)
 
+    def sweep(self, param_grid, **kwargs):
+        """
+        Solve the system for a set of parameter points,
+        recalculating only the stages with changed inputs.
+        """
+        return sweep(self, param_grid, **kwargs)
+
+    def batch_sweep(self, param_grid, batch_size=1000, **kwargs):
+        """
+        Solve the system for a set of lead parameters mulst, tlst, dlst,
+        using batched evaluation of the kernels.
+        """
+        return batch_sweep(self, param_grid, batch_size, **kwargs)
+
+    def stability_diagram(self, vgatelst, vbiaslst, bias=None, batch_size=1000, **kwargs):
+        """
+        Solve the system on a grid of gate and bias voltages,
+        diagonalising the quantum dot Hamiltonian only once.
+        """
+        return stability_diagram(self, vgatelst, vbiaslst, bias, batch_size, **kwargs)
+
 
 class BuilderManyBody(BuilderBase):
     """
@@ -319,7 +365,7 @@ class BuilderManyBody(BuilderBase):
                  Ea=None, Na=[0], Tba=None,
                  mulst={}, tlst={}, dband={}, kpnt=None,
                  kerntype='Pauli', symq=True, norm_row=0, solmethod=None,
-                 itype=0, dqawc_limit=10000, mfreeq=False, phi0_init=None,
+                 itype=0, dqawc_limit=10000, mfreeq=False, phi0_init=None, warmq=False,
                  mtype_qd=complex, mtype_leads=complex,
                  symmetry=None, herm_hs=True, herm_c=False, m_less_n=True):
 
@@ -329,7 +375,7 @@ class BuilderManyBody(BuilderBase):
         BuilderBase.__init__(self,
             nleads=nleads, mulst=mulst, tlst=tlst, dband=dband, kpnt=kpnt,
             kerntype=kerntype, symq=symq, norm_row=norm_row, solmethod=solmethod,
-            itype=itype, dqawc_limit=dqawc_limit, mfreeq=mfreeq, phi0_init=phi0_init,
+            itype=itype, dqawc_limit=dqawc_limit, mfreeq=mfreeq, phi0_init=phi0_init, warmq=warmq,
             mtype_qd=mtype_qd, mtype_leads=mtype_leads,
             symmetry=symmetry, herm_hs=herm_hs, herm_c=herm_c, m_less_n=m_less_n,
             indexing='charge')
@@ -337,6 +383,7 @@ class BuilderManyBody(BuilderBase):
         self._init_state_indexing(Na, Ea)
 
         self.qd.Ea = Ea
+        self.qd.Na = self.Na
         self.leads.Tba = Tba
 
     def _init_state_indexing(self, Na, Ea):
@@ -83,7 +83,7 @@ class BuilderElPh(BuilderBase):
                  indexing=None, kpnt=None,
                  kerntype='Pauli', symq=True, norm_row=0, solmethod=None,
                  itype=0, itype_ph=0, dqawc_limit=10000,
-                 mfreeq=False, phi0_init=None,
+                 mfreeq=False, phi0_init=None, warmq=False,
                  mtype_qd=complex, mtype_leads=complex,
                  symmetry=None, herm_hs=True, herm_c=False, m_less_n=True,
                  bath_func=None, eps_elph=1.0e-6):
@@ -168,7 +168,7 @@ class BuilderManyBodyElPh(BuilderElPh, BuilderManyBody):
                  Ea=None, Na=[0], Tba=None, Vbbp=None,
                  mulst={}, tlst={}, dband={}, tlst_ph={}, dband_ph={}, kpnt=None,
                  kerntype='Pauli', symq=True, norm_row=0, solmethod=None,
-                 itype=0, dqawc_limit=10000, mfreeq=False, phi0_init=None,
+                 itype=0, dqawc_limit=10000, mfreeq=False, phi0_init=None, warmq=False,
                  mtype_qd=complex, mtype_leads=complex,
                  symmetry=None, herm_hs=True, herm_c=False, m_less_n=True,
                  bath_func=None, eps_elph=1.0e-6):
@@ -181,7 +181,7 @@ class BuilderManyBodyElPh(BuilderElPh, BuilderManyBody):
             nleads=nleads, mulst=mulst, tlst=tlst, dband=dband,
             nbaths=nbaths, tlst_ph=tlst_ph, dband_ph=dband_ph, kpnt=kpnt,
             kerntype=kerntype, symq=symq, norm_row=norm_row, solmethod=solmethod,
-            itype=itype, dqawc_limit=dqawc_limit, mfreeq=mfreeq, phi0_init=phi0_init,
+            itype=itype, dqawc_limit=dqawc_limit, mfreeq=mfreeq, phi0_init=phi0_init, warmq=warmq,
             mtype_qd=mtype_qd, mtype_leads=mtype_leads,
             symmetry=symmetry, herm_hs=herm_hs, herm_c=herm_c, m_less_n=m_less_n,
             bath_func=bath_func, eps_elph=eps_elph,
@@ -1,5 +1,8 @@
 """Module containing FunctionProperties class."""
 
+from ..specfunc.specfunc import PrincipalValueTable
+from ..specfunc.specfunc import HilbertTransform
+
 
 class FunctionProperties(object):
     """
@@ -17,12 +20,20 @@ class FunctionProperties(object):
         String specifying the solution method of the equation L(Phi0)=0.
         The possible values are matrix inversion 'solve' and least squares 'lsqr'.
         Method 'solve' works only when symq=True.
+        Least squares can also be found using QR decomposition with column pivoting 'qr',
+        and the stationary state as the null vector of the kernel using LU decomposition 'lu'.
+        Both fall back to singular value decomposition based 'lsqr' for ill-conditioned kernels.
+        For Pauli approach the kernel can be solved by block-tridiagonal
+        elimination over the charge states using 'block'.
+        The kernel is generated as a sparse matrix for sparse LU decomposition 'spsolve'
+        and for iterative methods 'gmres', 'bicgstab' preconditioned with incomplete LU.
         For matrix free methods (used when mfreeq=True) the possible values are
         'krylov', 'broyden', etc.
     itype : int
         Type of integral for first order approach calculations.
         itype=0: the principal parts are evaluated using Fortran integration package QUADPACK \
-                 routine dqawc through SciPy.
+                 routine dqawc through SciPy. For many transitions the integrals in the band are \
+                 obtained from PrincipalValueTable, see get_pv_table().
         itype=1: the principal parts are kept, but approximated by digamma function valid for \
                  large bandwidth D.
         itype=2: the principal parts are neglected.
@@ -30,19 +41,62 @@ class FunctionProperties(object):
     dqawc_limit : int
         For itype=0 dqawc_limit determines the maximum number of sub-intervals
         in the partition of the given integration interval.
+    pv_tableq : bool
+        If pv_tableq=False the principal value integrals for itype=0 are always evaluated
+        by dqawc for each transition instead of using PrincipalValueTable.
+    pv_tables : dict
+        Cache of spline PrincipalValueTable objects for itype=0 keyed by (Rm, Rp, dqawc_limit),
+        where Rm=(Dm-mu)/T, Rp=(Dp-mu)/T are the reduced band edges.
+    pv_tables_size : int
+        Maximal number of the cached tables.
+    pv_table_nmin : int
+        Minimal number of transitions in the band of a lead, for which a new spline table is made.
+    pv_wide_nmin : int
+        Minimal number of transitions in the band of a lead, for which the wide band expression is used.
+    pv_rcut : float
+        The wide band expression is used when Rm < -pv_rcut and Rp > pv_rcut.
     mfreeq : bool
         If mfreeq=True the matrix free solution method is used for first order methods.
     phi0_init : array
         For mfreeq=True the initial value of zeroth order density matrix elements.
+    warmq : bool
+        If warmq=True the solution phi0 of the previous calculation is used as the initial guess
+        for matrix free and iterative sparse methods ('gmres', 'bicgstab'). For the iterative
+        methods also the incomplete LU preconditioner is reused while the kernel changes little.
+        For '2vN' approach the iterations start from phi1k of the previous calculation.
+        This is useful for parameter sweeps.
     mtype_qd : float or complex
         Type for the many-body quantum dot Hamiltonian matrix.
     mtype_leads : float or complex
         Type for the many-body tunneling matrix Tba.
     kpnt_left, kpnt_right : int
         Number of points Ek_grid is extended to the left and the right for '2vN' approach.
-    ht_ker : array
-        Kernel used when performing Hilbert transform using FFT.
-        It is generated using specfunc.kernel_fredriksen(n).
+    htransf : HilbertTransform
+        Object performing Hilbert transforms using FFT for '2vN' approach.
+        It caches the kernels generated using specfunc.kernel_fredriksen(n).
+    nthreads : int
+        Number of OpenMP threads, among which the energy grid points are distributed
+        in the iterations of Cython '2vN' approach. It is also the number of workers
+        used by the FFT Hilbert transforms.
+    mtype_2vN : complex or numpy.complex64
+        Type for the energy resolved arrays phi1k, phi1k_delta, hphi1k_delta, and the factors
+        in kern1k_lu of '2vN' approach. Single precision numpy.complex64 halves their memory.
+    iters_size : int
+        Maximal number of Iterations2vN objects kept in iters for '2vN' approach.
+        For iters_size=None all iterations are kept and for iters_size=0 none.
+    grid_2vN : str
+        Energy grid of '2vN' approach. For 'uniform' the grid is equidistant and for 'adaptive'
+        it is concentrated around the resonances, which needs fewer points for the same accuracy.
+        On the 'adaptive' grid the Hilbert transforms are dense matrix products instead of FFT,
+        so the matrix takes 8*n**2 bytes and each iteration costs O(n**2*nleads*ndm1*ndm0)
+        operations for n=len(Ek_grid_ext). For more than a few thousand points use 'uniform'.
+    grid_fct : float
+        Fraction of the points of the 'adaptive' grid, which are distributed uniformly.
+    fk_tables : dict
+        Cache of the Fermi functions and their Hilbert transforms on the extended grid
+        for '2vN' approach keyed by the grid, mulst, and tlst.
+    fk_tables_size : int
+        Maximal number of entries in fk_tables.
     emin, emax : float
         Minimal and maximal energy in the updated Ek_grid generated by neumann2py.get_grid_ext(sys).
         Note that emin<=Dmin and emax>=Dmax.
@@ -56,7 +110,7 @@ class FunctionProperties(object):
 
     def __init__(self,
                  kerntype='2vN', symq=True, norm_row=0, solmethod=None,
-                 itype=0, dqawc_limit=10000, mfreeq=False, phi0_init=None,
+                 itype=0, dqawc_limit=10000, mfreeq=False, phi0_init=None, warmq=False,
                  mtype_qd=float, mtype_leads=complex, kpnt=None, dband=None):
         self.kerntype = kerntype
         self.symq = symq
@@ -65,9 +119,16 @@ class FunctionProperties(object):
         #
         self.itype = itype
         self.dqawc_limit = dqawc_limit
+        self.pv_tableq = True
+        self.pv_tables = {}
+        self.pv_tables_size = 64
+        self.pv_table_nmin = 2048
+        self.pv_wide_nmin = 4
+        self.pv_rcut = 10.0
         #
         self.mfreeq = mfreeq
         self.phi0_init = phi0_init
+        self.warmq = warmq
         #
         self.mtype_qd = mtype_qd
         self.mtype_leads = mtype_leads
@@ -77,14 +138,65 @@ class FunctionProperties(object):
         #
         self.kpnt_left = 0
         self.kpnt_right = 0
-        self.ht_ker = None
+        self.htransf = HilbertTransform()
+        self.nthreads = 1
+        self.mtype_2vN = complex
+        self.iters_size = None
+        self.grid_2vN = 'uniform'
+        self.grid_fct = 0.3
+        self.fk_tables = {}
+        self.fk_tables_size = 8
         #
         self.dmin, self.dmax = 0, 0
         self.emin, self.emax = 0, 0
         self.ext_fct = 1.1
         #
         self.suppress_err = False
-        self.suppress_wrn = [False]
+        self.suppress_wrn = [False, False]
+
+    def get_pv_table(self, mu, T, Dm, Dp, ninband):
+        """
+        Returns the table of principal value integrals for given lead parameters.
+        The wide band expression is used when there are at least pv_wide_nmin
+        transitions in the band. Otherwise, the spline tables are cached with the
+        reduced band edges and dqawc_limit as the key, and a table for the reflected
+        band edges is also used. A new spline table is made only if there are
+        at least pv_table_nmin transitions in the band, because making it costs
+        about as much as the same number of dqawc calls. The least recently used
+        table is removed when the cache is full.
+
+        Parameters
+        ----------
+        mu, T : float
+            Chemical potential and temperature.
+        Dm, Dp : float
+            Bandwidth.
+        ninband : int
+            Number of the transitions in the band Dm < Ecb < Dp.
+
+        Returns
+        -------
+        table : PrincipalValueTable
+            Table of principal value integrals.
+        reflectq : bool
+            Indicates if the table is for the reflected band edges, see PrincipalValueTable.reflected().
+        """
+        Rm, Rp, limit = (Dm-mu)/T, (Dp-mu)/T, self.dqawc_limit
+        if Rm < -self.pv_rcut and Rp > self.pv_rcut:
+            tableq = ninband >= self.pv_wide_nmin
+            return PrincipalValueTable(Rm, Rp, limit, tableq, rcut=self.pv_rcut), False
+        for key, reflectq in [((Rm, Rp, limit), False), ((-Rp, -Rm, limit), True)]:
+            if key in self.pv_tables:
+                # Move the table to the end of the cache as the most recently used one
+                self.pv_tables[key] = self.pv_tables.pop(key)
+                return self.pv_tables[key], reflectq
+        if ninband < self.pv_table_nmin:
+            return PrincipalValueTable(Rm, Rp, limit, tableq=False), False
+        if len(self.pv_tables) >= self.pv_tables_size:
+            self.pv_tables.pop(next(iter(self.pv_tables)))
+        table = PrincipalValueTable(Rm, Rp, limit, rcut=self.pv_rcut)
+        self.pv_tables[(Rm, Rp, limit)] = table
+        return table, False
 
     def print_error(self, exept):
         if not self.suppress_err:
@@ -0,0 +1,430 @@
+"""Module containing functions for performing parameter sweeps."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+import itertools
+import multiprocessing
+import numpy as np
+
+from ..leadstun import make_array
+from ..leadstun import make_array_dlst
+
+# Stages of the calculation, which have to be repeated when the parameter changes.
+# 'qd' - diagonalise quantum dot Hamiltonian, rotate Tba, and solve the master equation
+# 'leads' - rotate Tba (and Vbbp) and solve the master equation
+# 'master' - solve the master equation
+stage_map = dict(
+    hsingle='qd', coulomb='qd',
+    tleads='leads', velph='leads',
+    mulst='master', tlst='master', dlst='master',
+    tlst_ph='master', dlst_ph='master',
+    )
+
+stage_order = {None: 0, 'master': 1, 'leads': 2, 'qd': 3}
+
+
+class SweepResults(object):
+    """
+    Class for storing the results of a parameter sweep.
+
+    Attributes
+    ----------
+    points : list
+        List of dictionaries containing the parameters at each point of the sweep.
+    current : array
+        npoints by nleads array containing the currents.
+    energy_current : array
+        npoints by nleads array containing the energy currents.
+    heat_current : array
+        npoints by nleads array containing the heat currents.
+    phi0 : array
+        Array containing the values of zeroth order density matrix elements
+        for each point of the sweep.
+    success : array
+        Array indicating if the master equation was successfully solved at each point.
+    stages : list
+        List containing the most expensive stage ('qd', 'leads', 'master', or None),
+        which was recalculated at each point.
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.current = []
+        self.energy_current = []
+        self.heat_current = []
+        self.phi0 = []
+        self.success = []
+        self.stages = []
+
+    def append(self, appr, stage):
+        self.current.append(np.array(appr.current))
+        self.energy_current.append(np.array(appr.energy_current))
+        self.heat_current.append(np.array(appr.heat_current))
+        self.phi0.append(np.array(appr.phi0))
+        self.success.append(getattr(appr, 'success', True))
+        self.stages.append(stage)
+
+    def extend(self, other):
+        self.current.extend(other.current)
+        self.energy_current.extend(other.energy_current)
+        self.heat_current.extend(other.heat_current)
+        self.phi0.extend(other.phi0)
+        self.success.extend(other.success)
+        self.stages.extend(other.stages)
+
+    def stack(self):
+        self.current = np.array(self.current)
+        self.energy_current = np.array(self.energy_current)
+        self.heat_current = np.array(self.heat_current)
+        self.phi0 = np.array(self.phi0)
+        self.success = np.array(self.success, dtype=bool)
+
+
+def make_points(param_grid):
+    """
+    Makes a list of parameter points from the parameter grid.
+
+    Parameters
+    ----------
+    param_grid : dict or list
+        If param_grid is a list of dictionaries, each dictionary describes one point.
+        If param_grid is a dictionary mapping parameter names to lists of values,
+        the points are given by all combinations of the values, with the
+        last parameter varying the fastest.
+
+    Returns
+    -------
+    list
+        List of dictionaries describing the points.
+    """
+    if isinstance(param_grid, dict):
+        names = list(param_grid.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*[param_grid[name] for name in names])]
+    return list(param_grid)
+
+
+def value_changed(old, new):
+    """Checks if the value of a parameter differs from its previous value."""
+    if isinstance(old, dict) or isinstance(new, dict):
+        return old != new
+    return not np.array_equal(old, new)
+
+
+def get_stage(point, point_prev):
+    """
+    Determines the most expensive stage of the calculation, which has to be repeated.
+
+    Parameters
+    ----------
+    point : dict
+        Parameters of the current point.
+    point_prev : dict or None
+        Parameters of the previous point. If None, everything is recalculated.
+
+    Returns
+    -------
+    string or None
+        'qd', 'leads', 'master', or None if nothing has to be recalculated.
+    """
+    if point_prev is None:
+        return 'qd'
+    stage = None
+    for name in point:
+        if name not in point_prev or value_changed(point_prev[name], point[name]):
+            new_stage = stage_map.get(name, 'master')
+            stage = new_stage if stage_order[new_stage] > stage_order[stage] else stage
+    return stage
+
+
+def set_point(self, point):
+    """
+    Sets the parameters of the system to the values given by the point.
+
+    Parameters
+    ----------
+    self : Builder
+        Builder object.
+    point : dict
+        Dictionary mapping parameter names to values. The parameters hsingle, coulomb,
+        tleads, mulst, tlst, dlst, velph, tlst_ph, dlst_ph are changed using Builder.change(),
+        other parameters like itype are set as attributes of the Builder.
+    """
+    change_params = {}
+    for name in point:
+        if name in stage_map:
+            change_params[name] = point[name]
+        else:
+            setattr(self, name, point[name])
+    if change_params:
+        self.change(**change_params)
+
+
+def sweep(self, param_grid, **kwargs):
+    """
+    Solves the system for a set of parameter points. At each point only the stages
+    of the calculation with changed inputs are performed, i.e.,
+    hsingle, coulomb -> diagonalise -> rotate Tba -> solve master equation;
+    tleads, velph -> rotate Tba, Vbbp -> solve master equation;
+    mulst, tlst, dlst, tlst_ph, dlst_ph, etc. -> solve master equation.
+    The gate voltage vgate is set as an attribute of the Builder, which shifts
+    the energies analytically, so only the master equation is solved.
+    With warmq=True the matrix free and iterative sparse solvers are started from the
+    solution at the previous point.
+
+    Parameters
+    ----------
+    self : Builder
+        Builder object.
+    param_grid : dict or list
+        Parameter points. See make_points().
+    kwargs
+        Additional keyword arguments passed to Approach.solve(), for example, niter for 2vN approach.
+
+    Returns
+    -------
+    SweepResults
+        Object containing stacked currents and density matrices.
+    """
+    appr = self.appr
+    points = make_points(param_grid)
+    results = SweepResults(points)
+    point_prev = None
+    for point in points:
+        stage = get_stage(point, point_prev)
+        set_point(self, point)
+        # The approach can be changed by setting kerntype
+        if appr is not self.appr:
+            appr, stage = self.appr, 'qd'
+        #
+        if stage == 'qd':
+            appr.solve(qdq=True, rotateq=True, **kwargs)
+        elif stage == 'leads':
+            self.leads.rotate(self.qd.vecslst)
+            if hasattr(self, 'baths'):
+                self.baths.rotate(self.qd.vecslst)
+            appr.solve(qdq=False, **kwargs)
+        elif stage == 'master':
+            appr.solve(qdq=False, **kwargs)
+        results.append(appr, stage)
+        point_prev = copy.deepcopy(point)
+    results.stack()
+    return results
+
+
+# Parameters, which can be evaluated in a batch. The gate voltage vgate only
+# shifts the energies Ea, so the points with the same vgate are solved together.
+batch_params = {'mulst', 'tlst', 'dlst', 'vgate'}
+
+
+def batch_sweep(self, param_grid, batch_size=1000, **kwargs):
+    """
+    Solves the system for a set of points, which differ only by mulst, tlst, dlst, and vgate,
+    using batched evaluation of factors, kernels, stationary states, and currents.
+    The quantum dot is diagonalised once and the gate voltage vgate is applied
+    by shifting the energies analytically. Consecutive points with the same vgate
+    are solved in one batch. If the approach does not support batched
+    solution or other parameters are swept, Builder.sweep() is used instead.
+
+    Parameters
+    ----------
+    self : Builder
+        Builder object.
+    param_grid : dict or list
+        Parameter points. See make_points().
+    batch_size : int
+        Maximal number of points solved in one batch, which limits
+        the memory used by the stack of kernels.
+    kwargs
+        Keyword arguments passed to Builder.sweep(), when it is used instead.
+
+    Returns
+    -------
+    SweepResults
+        Object containing stacked currents and density matrices.
+    """
+    appr, si = self.appr, self.si
+    points = make_points(param_grid)
+    if not appr.get_batchq() or self.funcp.mfreeq or any(set(point) - batch_params for point in points):
+        print("WARNING: Batched sweep is only possible over mulst, tlst, dlst, vgate for approaches " +
+              "supporting it. Using Builder.sweep() instead.")
+        return sweep(self, points, **kwargs)
+    # Convert the points to arrays in the same way as LeadsTunneling.change()
+    leads = self.leads
+    mulst, tlst, dlst = np.array(leads.mulst), np.array(leads.tlst), np.array(leads.dlst)
+    vgate = self.qd.vgate
+    mulst_arr, tlst_arr, dlst_arr, vgate_arr = [], [], [], []
+    for point in points:
+        if 'mulst' in point:
+            mulst = make_array(np.array(mulst), point['mulst'], si)
+        if 'tlst' in point:
+            tlst = make_array(np.array(tlst), point['tlst'], si)
+        if 'dlst' in point:
+            dlst = make_array_dlst(np.array(dlst), point['dlst'], si)
+        vgate = point.get('vgate', vgate)
+        mulst_arr.append(mulst)
+        tlst_arr.append(tlst)
+        dlst_arr.append(dlst)
+        vgate_arr.append(vgate)
+    mulst_arr, tlst_arr, dlst_arr = np.array(mulst_arr), np.array(tlst_arr), np.array(dlst_arr)
+    # Split the points into batches with the same gate voltage
+    chunks = []
+    for start in range(len(points)):
+        if start == 0 or vgate_arr[start] != vgate_arr[start-1] or start-chunks[-1][0] == batch_size:
+            chunks.append([start, start+1])
+        else:
+            chunks[-1][1] = start+1
+    #
+    results = SweepResults(points)
+    for start, end in chunks:
+        self.qd.set_gate(vgate_arr[start])
+        appr.solve_batch(mulst_arr[start:end], tlst_arr[start:end], dlst_arr[start:end], qdq=(start == 0))
+        results.current.extend(appr.current_batch)
+        results.energy_current.extend(appr.energy_current_batch)
+        results.heat_current.extend(appr.heat_current_batch)
+        results.phi0.extend(appr.phi0_batch)
+        results.success.extend(appr.success_batch)
+    results.stages = ['qd'] + ['master']*(len(points)-1)
+    results.stack()
+    # Leave the system in the state of the last point
+    if len(points) > 0:
+        leads.mulst, leads.tlst, leads.dlst = mulst, tlst, dlst
+        appr.phi0, appr.success = results.phi0[-1], results.success[-1]
+        appr.current = results.current[-1]
+        appr.energy_current = results.energy_current[-1]
+        appr.heat_current = results.heat_current[-1]
+    return results
+
+
+def stability_diagram(self, vgatelst, vbiaslst, bias=None, batch_size=1000, **kwargs):
+    """
+    Solves the system on a grid of gate and bias voltages. The quantum dot Hamiltonian
+    is diagonalised once, the gate voltage shifts the energies Ea analytically,
+    and the bias voltage shifts the chemical potentials of the leads.
+    The points are solved by Builder.batch_sweep().
+
+    Parameters
+    ----------
+    self : Builder
+        Builder object.
+    vgatelst : array
+        List of gate voltages.
+    vbiaslst : array
+        List of bias voltages.
+    bias : array
+        Array with nleads entries. The chemical potentials at bias voltage vbias are
+        mulst = bias*vbias. By default, bias[l] = 1/2 for even l and -1/2 for odd l, which for the leads ordered
+        as (L, R) or (L up, R up, L down, R down) gives mu_L-mu_R = vbias.
+    batch_size : int
+        Maximal number of points solved in one batch.
+    kwargs
+        Keyword arguments passed to Builder.sweep(), when it is used instead of batched solution.
+
+    Returns
+    -------
+    SweepResults
+        Object containing the results, where current, energy_current, heat_current,
+        phi0, and success are reshaped to have the first two axes enumerating
+        vgatelst and vbiaslst.
+    """
+    if bias is None:
+        bias = [0.5 if l % 2 == 0 else -0.5 for l in range(len(self.leads.mulst))]
+    points = [{'vgate': vgate, 'mulst': np.asarray(bias, dtype=float)*vbias}
+              for vgate in vgatelst for vbias in vbiaslst]
+    results = batch_sweep(self, points, batch_size, **kwargs)
+    shape = (len(vgatelst), len(vbiaslst))
+    for name in ['current', 'energy_current', 'heat_current', 'phi0', 'success']:
+        value = getattr(results, name)
+        setattr(results, name, value.reshape(shape + value.shape[1:]))
+    results.vgatelst, results.vbiaslst = np.array(vgatelst), np.array(vbiaslst)
+    return results
+
+
+# Builder of a worker process of parallel_sweep(), which is set once by init_worker()
+worker_builder = None
+
+
+def init_worker(builder):
+    """
+    Initializer of the worker processes of parallel_sweep(). The Builder is
+    unpickled and stored once per worker, and reused for all the chunks solved by the worker.
+    """
+    global worker_builder
+    worker_builder = builder
+
+
+def sweep_chunk(points, kwargs, builder=None):
+    """
+    Performs a sweep over a chunk of points in a worker process.
+    If builder is None, the Builder stored by init_worker() is used.
+
+    Returns
+    -------
+    SweepResults
+        Results for the chunk, which are not stacked.
+    """
+    builder = worker_builder if builder is None else builder
+    results = sweep(builder, points, **kwargs)
+    for name in ['current', 'energy_current', 'heat_current', 'phi0', 'success']:
+        setattr(results, name, list(getattr(results, name)))
+    return results
+
+
+def parallel_sweep(builder, param_grid, executor=None, chunksize=None, max_workers=None, **kwargs):
+    """
+    Solves the system for a set of parameter points in parallel using a process pool.
+    The points are split into contiguous chunks and each chunk is solved by
+    Builder.sweep() on a copy of the builder. The copy is sent once to each worker
+    process and is reused for all chunks solved by the worker, so each point has
+    to specify all swept parameters.
+
+    Parameters
+    ----------
+    builder : Builder
+        Builder object, which is sent to the worker processes.
+    param_grid : dict or list
+        Parameter points. See make_points().
+    executor : concurrent.futures.Executor
+        Executor used to run the chunks. If None, a ProcessPoolExecutor
+        with max_workers processes is created and shut down afterwards.
+        For a given executor the builder cannot be stored in its workers,
+        so it is sent together with each chunk.
+    chunksize : int
+        Number of points in one chunk. By default, the points are split into
+        approximately four chunks per worker.
+    max_workers : int
+        Number of worker processes when the executor is not given.
+        The default is the number of processors.
+    kwargs
+        Additional keyword arguments passed to Approach.solve().
+
+    Returns
+    -------
+    SweepResults
+        Object containing stacked currents and density matrices.
+    """
+    points = make_points(param_grid)
+    if chunksize is None:
+        nworkers = max_workers or multiprocessing.cpu_count()
+        chunksize = max(1, -(-len(points)//(4*nworkers)))
+    chunks = [points[i:i+chunksize] for i in range(0, len(points), chunksize)]
+    #
+    shutdownq = executor is None
+    if shutdownq:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker, initargs=(builder,))
+        chunk_builder = None
+    else:
+        chunk_builder = builder
+    try:
+        futures = [executor.submit(sweep_chunk, chunk, kwargs, chunk_builder) for chunk in chunks]
+        results = SweepResults(points)
+        for future in futures:
+            results.extend(future.result())
+    finally:
+        if shutdownq:
+            executor.shutdown()
+    results.stack()
+    return results
@@ -255,6 +255,8 @@ def remove_coherences(self, dE):
     self.si.mapdm0 : list
         (Modifies) List showing which density matrix elements are mapped to each other due to symmetries
         and which density matrix elements are neglected (entries with values -1).
+    self.si.plans : dict
+        (Modifies) Kernel assembly plans are cleared.
     """
     # Find which coherences to remove
     si, E = self.si, self.qd.Ea
@@ -284,6 +286,7 @@ def remove_coherences(self, dE):
     si.ndm0r = 2*si.ndm0-si.npauli
     for i in range(len(indlst)):
         si.mapdm0[ilst[i]] = indlst[i]
+    si.plans = {}
 
 
 def remove_states(self, dE):
@@ -740,6 +740,8 @@ class StateIndexingPauli(StateIndexing):
         """
         Reduce the number of diagonal matrix elements by using symmetries.
         """
+        # Kernel assembly plans depend on the indexing
+        self.plans = {}
         # noinspection PyShadowingNames
         def add_elem(counter, b, bp, charge, dictq=True):
             bbp = self.get_ind_dm0(b, bp, charge, maptype=0)
@@ -855,6 +857,8 @@ class StateIndexingDM(StateIndexing):
         From example for mapdm0 we have booldm0[1]=True, booldm0[2]=False.
     conjdm0 : list
         List showing, which density matrix elements are complex conjugate and are not unique.
+    plans : dict
+        Kernel assembly plans for this indexing, which are cleared when the indexing changes.
     """
 
     def __init__(self, nsingle, indexing='Lin', symmetry=None, nleads=0):
@@ -921,6 +925,8 @@ class StateIndexingDM(StateIndexing):
         """
         Reduce the number of diagonal matrix elements by using symmetries.
         """
+        # Kernel assembly plans depend on the indexing
+        self.plans = {}
         # noinspection PyShadowingNames
         def add_elem(counter, b, bp, charge, dictq=True, conjq=True):
             bbp = self.get_ind_dm0(b, bp, charge, maptype=0)
@@ -1054,7 +1060,9 @@ class StateIndexingDMc(StateIndexing):
 
     Attributes
     ----------
-    Same as in StateIndexingDM.
+    Same as in StateIndexingDM and additionally
+    transpdm0 : numpy array
+        Array giving the index of Phi[0]_{bp,b} for the index of Phi[0]_{b,bp}.
     """
 
     def __init__(self, nsingle, indexing='Lin', symmetry=None, nleads=0):
@@ -1121,6 +1129,8 @@ class StateIndexingDMc(StateIndexing):
         """
         Reduce the number of diagonal matrix elements by using symmetries.
         """
+        # Kernel assembly plans depend on the indexing
+        self.plans = {}
         # noinspection PyShadowingNames
         def add_elem(counter, b, bp, charge, dictq=True):
             bbp = self.get_ind_dm0(b, bp, charge, maptype=0)
@@ -1172,6 +1182,14 @@ class StateIndexingDMc(StateIndexing):
         self.ndm0 = counter
         self.ndm0r = self.npauli+2*(self.ndm0-self.npauli)
         self.ndm1 = self.ndm1_
+        # Interchange of the states b and bp in Phi[0]_{b,bp}
+        self.transpdm0 = np.arange(self.ndm0, dtype=longnp)
+        for charge in range(self.ncharge):
+            n = self.lenlst[charge]
+            ind = self.shiftlst0[charge] + np.arange(n*n).reshape(n, n)
+            (bbp, bpb) = (self.mapdm0[ind.ravel()], self.mapdm0[ind.T.ravel()])
+            valid = np.logical_and(bbp >= 0, bpb >= 0)
+            self.transpdm0[bbp[valid]] = bpb[valid]
 
     def get_ind_dm0(self, b, bp, charge, maptype=1):
         """
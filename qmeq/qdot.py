@@ -728,6 +728,12 @@ class QuantumDot(object):
         Hamiltonian for definite charge.
     Ea : ndarray
         nmany by 1 array containing many-body Hamiltonian eigenvalues.
+    vgate : float
+        Gate voltage, which adds the term -vgate*N to the Hamiltonian, where N is the
+        total number of particles. Because this term commutes with the Hamiltonian,
+        it shifts the eigenvalues Ea of each charge block without changing the eigenvectors.
+    Na : ndarray
+        nmany by 1 array containing particle numbers of many-body states.
     """
 
     def __init__(self, hsingle, coulomb, si,
@@ -742,6 +748,7 @@ class QuantumDot(object):
         self.m_less_n = m_less_n
         self.hsingle = make_hsingle_dict(self, hsingle)
         self.coulomb = make_coulomb_dict(self, coulomb)
+        self.vgate = 0.0
         self._init_hamiltonian()
 
     def _init_hamiltonian(self):
@@ -761,6 +768,7 @@ class QuantumDot(object):
         self.add(self.hsingle, self.coulomb, False)
         self.Ea = np.zeros(si.nmany, dtype=float)
         self.Ea_ext = None
+        self.Na = None
 
     def add(self, hsingle=None, coulomb=None, updateq=True):
         """
@@ -941,3 +949,32 @@ class QuantumDot(object):
     def set_Ea(self):
         """Sets the many-body eigenstates using construct_Ea_manybody()."""
         self.Ea = construct_Ea_manybody(self.valslst, self.si)
+        if self.vgate != 0:
+            self.Ea -= self.vgate*self.get_Na()
+
+    def get_Na(self):
+        """Returns the particle numbers of many-body states."""
+        if self.Na is None:
+            si = self.si
+            self.Na = np.zeros(si.nmany, dtype=int)
+            for charge in range(si.ncharge):
+                self.Na[si.chargelst[charge]] = charge
+        return self.Na
+
+    def set_gate(self, vgate):
+        """
+        Changes the gate voltage by shifting the many-body eigenvalues Ea analytically,
+        i.e., without diagonalisation of the Hamiltonian. The eigenvectors vecslst
+        and the tunneling amplitudes Tba remain unchanged.
+
+        Parameters
+        ----------
+        vgate : float
+            New value of the gate voltage.
+
+        self.Ea : ndarray
+            (Modifies) Many-body eigenvalues shifted by -(vgate-self.vgate)*Na.
+        """
+        if vgate != self.vgate:
+            self.Ea = self.Ea - (vgate-self.vgate)*self.get_Na()
+            self.vgate = vgate
@@ -0,0 +1,484 @@
+"""Module containing methods for finding the stationary state of a master equation kernel."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+from scipy import linalg
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
+
+from .mytypes import doublenp
+from .mytypes import longnp
+
+
+def solve_block_tridiag(diag, lower, upper, norm_vec=None, rescale=1e100):
+    """
+    Finds the stationary state of a block-tridiagonal kernel using block Thomas elimination.
+
+    The kernel has to be a generator of a continuous time Markov chain, i.e., its columns
+    sum to zero. The blocks are eliminated from the first to the last one using Schur
+    complements. The last Schur complement corresponds to the kernel of the chain censored
+    to the last block, for which the null vector is found together with normalisation
+    condition. The remaining blocks are obtained by back substitution and the whole
+    solution is normalised at the end.
+
+    Parameters
+    ----------
+    diag : list of ndarrays
+        diag[k] is the diagonal block of the kernel for sector k.
+    lower : list of ndarrays
+        lower[k] is the block coupling sector k to sector k-1 (rows k, columns k-1).
+        lower[0] is not used.
+    upper : list of ndarrays
+        upper[k] is the block coupling sector k to sector k+1 (rows k, columns k+1).
+        upper[-1] is not used.
+    norm_vec : ndarray
+        Left hand side of the normalisation condition. If None, the entries
+        of the solution are normalised to sum up to one.
+    rescale : float
+        During back substitution the solution is rescaled when its magnitude
+        exceeds this value, which prevents overflows for exponentially small occupations.
+
+    Returns
+    -------
+    ndarray
+        Normalised stationary state of the kernel with all the sectors concatenated.
+    """
+    nsec = len(diag)
+    # Forward elimination
+    # S[k] = D[k] - L[k] S[k-1]^{-1} U[k-1],  X[k] = S[k]^{-1} U[k]
+    xlst = [None]*nsec
+    schur = diag[0]
+    for k in range(1, nsec):
+        xlst[k-1] = np.linalg.solve(schur, upper[k-1])
+        schur = diag[k] - np.dot(lower[k], xlst[k-1])
+    # Null vector of the last Schur complement with the normalisation condition
+    schur = np.array(schur, dtype=doublenp)
+    schur[0] = 1
+    bvec = np.zeros(schur.shape[0], dtype=doublenp)
+    bvec[0] = 1
+    sollst = [None]*nsec
+    sollst[-1] = np.linalg.solve(schur, bvec)
+    # Back substitution
+    for k in range(nsec-2, -1, -1):
+        sollst[k] = -np.dot(xlst[k], sollst[k+1])
+        scale = np.max(np.abs(sollst[k]))
+        if scale > rescale:
+            for j in range(k, nsec):
+                sollst[j] = sollst[j]/scale
+    phi0 = np.concatenate(sollst)
+    norm = np.sum(phi0) if norm_vec is None else np.dot(norm_vec, phi0)
+    return phi0/norm
+
+
+def residual_block_tridiag(diag, lower, upper, phi0):
+    """
+    Calculates the norm of a block-tridiagonal kernel acting on a vector
+    without forming the full kernel matrix.
+
+    Parameters
+    ----------
+    diag, lower, upper : list of ndarrays
+        Blocks of the kernel, see solve_block_tridiag.
+    phi0 : ndarray
+        Vector with all the sectors concatenated.
+
+    Returns
+    -------
+    float
+        Norm of the kernel acting on phi0.
+    """
+    nsec = len(diag)
+    ind = np.cumsum([0]+[len(block) for block in diag])
+    sollst = [phi0[ind[k]:ind[k+1]] for k in range(nsec)]
+    res = 0.0
+    for k in range(nsec):
+        resk = np.dot(diag[k], sollst[k])
+        if k > 0:
+            resk += np.dot(lower[k], sollst[k-1])
+        if k < nsec-1:
+            resk += np.dot(upper[k], sollst[k+1])
+        res += np.dot(resk, resk)
+    return np.sqrt(res)
+
+
+def block_tridiag_to_dense(diag, lower, upper):
+    """
+    Makes the dense matrix from the blocks of a block-tridiagonal matrix.
+
+    Parameters
+    ----------
+    diag, lower, upper : list of ndarrays
+        Blocks of the matrix, see solve_block_tridiag.
+
+    Returns
+    -------
+    ndarray
+        Dense matrix with all the sectors concatenated.
+    """
+    nsec = len(diag)
+    ind = np.cumsum([0]+[len(block) for block in diag])
+    kern = np.zeros((ind[-1], ind[-1]), dtype=doublenp)
+    for k in range(nsec):
+        rows = slice(ind[k], ind[k+1])
+        kern[rows, rows] = diag[k]
+        if k > 0:
+            kern[rows, ind[k-1]:ind[k]] = lower[k]
+        if k < nsec-1:
+            kern[rows, ind[k+1]:ind[k+2]] = upper[k]
+    return kern
+
+
+def lu_factor_batch(a):
+    """
+    LU decomposition with partial pivoting of a stack of square matrices. The loop runs over the
+    columns, so it is efficient for many small matrices. The format of the factors is the same
+    as for scipy.linalg.lu_factor.
+
+    Parameters
+    ----------
+    a : ndarray
+        npoints by n by n array containing the matrices.
+
+    Returns
+    -------
+    lu : ndarray
+        npoints by n by n array with the upper triangular factors U and the unit lower
+        triangular factors L without the diagonal.
+    piv : ndarray
+        npoints by n array of pivot indices. Row j was interchanged with row piv[:, j].
+    """
+    lu = np.array(a)
+    (npoints, n) = (lu.shape[0], lu.shape[-1])
+    piv = np.zeros((npoints, n), dtype=longnp)
+    pnts = np.arange(npoints)
+    for j in range(n):
+        p = j + np.argmax(np.abs(lu[:, j:, j]), axis=1)
+        piv[:, j] = p
+        row = lu[pnts, p]
+        lu[pnts, p] = lu[:, j]
+        lu[:, j] = row
+        lu[:, j+1:, j] /= lu[:, j, j, None]
+        lu[:, j+1:, j+1:] -= lu[:, j+1:, j, None]*lu[:, j, None, j+1:]
+    return lu, piv
+
+
+def lu_solve_batch(lu, piv, b):
+    """
+    Solves a stack of linear equations using the factors from lu_factor_batch.
+
+    Parameters
+    ----------
+    lu, piv : ndarray
+        Factors from lu_factor_batch.
+    b : ndarray
+        npoints by n by m array containing the right hand sides.
+
+    Returns
+    -------
+    ndarray
+        npoints by n by m array containing the solutions.
+    """
+    x = np.array(b, dtype=np.result_type(lu, b))
+    (npoints, n) = (lu.shape[0], lu.shape[-1])
+    pnts = np.arange(npoints)
+    for j in range(n):
+        row = x[pnts, piv[:, j]]
+        x[pnts, piv[:, j]] = x[:, j]
+        x[:, j] = row
+    for j in range(n):
+        x[:, j+1:] -= lu[:, j+1:, j, None]*x[:, j, None]
+    for j in range(n-1, -1, -1):
+        x[:, j] /= lu[:, j, j, None]
+        x[:, :j] -= lu[:, :j, j, None]*x[:, j, None]
+    return x
+
+
+def lu_factor_block_tridiag(diag, lower, upper):
+    """
+    Block LU decomposition of a stack of block-tridiagonal matrices. For the Schur complements
+    S[k] = D[k] - L[k] S[k-1]^{-1} U[k-1] the LU factors and X[k] = S[k]^{-1} U[k] are stored.
+    The sectors of zero size are allowed.
+
+    Parameters
+    ----------
+    diag, lower, upper : list of ndarrays
+        Stacks of the blocks with the first axis enumerating the points, see solve_block_tridiag.
+
+    Returns
+    -------
+    lulst, pivlst : list of ndarrays
+        Factors of the Schur complements from lu_factor_batch.
+    xlst : list of ndarrays
+        Blocks X[k]. The last entry is None.
+    """
+    nsec = len(diag)
+    (lulst, pivlst, xlst) = ([None]*nsec, [None]*nsec, [None]*nsec)
+    schur = diag[0]
+    for k in range(nsec):
+        if k > 0:
+            schur = diag[k] - np.matmul(lower[k], xlst[k-1])
+        lulst[k], pivlst[k] = lu_factor_batch(schur)
+        if k < nsec-1:
+            xlst[k] = lu_solve_batch(lulst[k], pivlst[k], upper[k])
+    return lulst, pivlst, xlst
+
+
+def lu_solve_block_tridiag(lulst, pivlst, lower, xlst, b):
+    """
+    Solves a stack of block-tridiagonal linear equations using the factors
+    from lu_factor_block_tridiag.
+
+    Parameters
+    ----------
+    lulst, pivlst, xlst : list of ndarrays
+        Factors from lu_factor_block_tridiag.
+    lower : list of ndarrays
+        Stacks of the blocks coupling sector k to sector k-1.
+    b : list of ndarrays
+        Right hand sides for each sector with dimensions (npoints, n[k], m).
+
+    Returns
+    -------
+    list of ndarrays
+        Solutions for each sector.
+    """
+    nsec = len(lulst)
+    sollst = [None]*nsec
+    for k in range(nsec):
+        rhs = b[k] if k == 0 else b[k] - np.matmul(lower[k], sollst[k-1])
+        sollst[k] = lu_solve_batch(lulst[k], pivlst[k], rhs)
+    for k in range(nsec-2, -1, -1):
+        sollst[k] = sollst[k] - np.matmul(xlst[k], sollst[k+1])
+    return sollst
+
+
+def solve_lstsq(kern, bvec):
+    """
+    Solves the master equation using least squares based on singular value decomposition.
+
+    Returns
+    -------
+    phi0 : ndarray
+        Solution of the master equation.
+    cond : float
+        Condition number of the kernel given by the ratio of singular values.
+    """
+    sol = np.linalg.lstsq(kern, bvec, rcond=-1)
+    sv = sol[3]
+    cond = sv[0]/sv[-1] if sv[-1] != 0 else np.inf
+    return sol[0], cond
+
+
+def solve_lstsq_qr(kern, bvec, rtol=None):
+    """
+    Solves the master equation using least squares based on QR decomposition
+    with column pivoting. If the kernel is found to be rank deficient,
+    singular value decomposition based least squares is used instead.
+
+    Parameters
+    ----------
+    kern : ndarray
+        Kernel matrix with the normalisation condition included, of size N+1 by N or N by N.
+    bvec : ndarray
+        Right hand side column vector for master equation.
+    rtol : float
+        Diagonal entries of R smaller than rtol times the largest entry are treated as zero.
+        The default is max(kern.shape) times machine epsilon.
+
+    Returns
+    -------
+    phi0 : ndarray
+        Solution of the master equation.
+    cond : float
+        Estimate of the condition number given by the ratio of diagonal entries of R.
+    """
+    q, r, perm = linalg.qr(kern, mode='economic', pivoting=True)
+    rdiag = np.abs(np.diag(r))
+    rtol = max(kern.shape)*np.finfo(doublenp).eps if rtol is None else rtol
+    if rdiag[-1] <= rtol*rdiag[0]:
+        return solve_lstsq(kern, bvec)
+    phi0 = np.zeros(kern.shape[1], dtype=np.result_type(kern, bvec))
+    phi0[perm] = linalg.solve_triangular(r, np.dot(q.conj().T, bvec))
+    return phi0, rdiag[0]/rdiag[-1]
+
+
+def solve_lstsq_batch(kern, bvec, rtol=None):
+    """
+    Solves a stack of master equations using least squares based on batched QR decomposition.
+    The points, for which the kernel is found to be rank deficient, are solved one by one
+    using singular value decomposition based least squares.
+
+    Parameters
+    ----------
+    kern : ndarray
+        npoints by N+1 by N array of kernels with the normalisation condition included.
+    bvec : ndarray
+        npoints by N+1 array of right hand sides.
+    rtol : float
+        Diagonal entries of R smaller than rtol times the largest entry are treated as zero.
+        The default is max(kern.shape[1:]) times machine epsilon.
+
+    Returns
+    -------
+    ndarray
+        npoints by N array of solutions.
+    """
+    q, r = np.linalg.qr(kern)
+    rdiag = np.abs(np.diagonal(r, axis1=1, axis2=2))
+    rtol = max(kern.shape[1:])*np.finfo(doublenp).eps if rtol is None else rtol
+    deficient = np.min(rdiag, axis=1) <= rtol*np.max(rdiag, axis=1)
+    # Regularise the deficient points, which are overwritten below
+    r[deficient] = np.eye(r.shape[-1])
+    phi0 = np.linalg.solve(r, np.einsum('pji,pj->pi', q.conj(), bvec))
+    for i in np.nonzero(deficient)[0]:
+        phi0[i] = solve_lstsq(kern[i], bvec[i])[0]
+    return phi0
+
+
+def solve_null_lu(kern, norm_vec, rtol=1e-8):
+    """
+    Finds the stationary state as the null vector of the kernel using LU decomposition
+    with partial pivoting. The smallest pivot of U is treated as zero and the null vector
+    is found by back substitution. If the relative residual of the null vector exceeds rtol
+    or the null vector cannot be normalised, singular value decomposition based least
+    squares is used instead.
+
+    Parameters
+    ----------
+    kern : ndarray
+        Square kernel matrix without the normalisation condition.
+    norm_vec : ndarray
+        Left hand side of the normalisation condition.
+    rtol : float
+        Maximal allowed relative residual |kern phi0|/(|kern| |phi0|).
+
+    Returns
+    -------
+    phi0 : ndarray
+        Normalised stationary state.
+    cond : float
+        Estimate of the condition number of the kernel restricted to the complement
+        of the null space, given by the ratio of pivots of U.
+    """
+    _, l, u = linalg.lu(kern)
+    udiag = np.abs(np.diag(u))
+    k = np.argmin(udiag)
+    null_vec = np.zeros(kern.shape[1], dtype=u.dtype)
+    null_vec[k] = 1
+    if k > 0:
+        null_vec[0:k] = -linalg.solve_triangular(u[0:k, 0:k], u[0:k, k])
+    norm = np.dot(norm_vec, null_vec)
+    if norm != 0 and np.all(np.isfinite(null_vec)):
+        phi0 = null_vec/norm
+        residual = np.linalg.norm(np.dot(kern, phi0))
+        if residual <= rtol*np.linalg.norm(kern)*np.linalg.norm(phi0):
+            pivots = np.sort(udiag)
+            cond = 1.0 if len(pivots) == 1 else (pivots[-1]/pivots[1] if pivots[1] != 0 else np.inf)
+            return phi0, cond
+    kern_ext = np.vstack([kern, norm_vec])
+    bvec_ext = np.zeros(kern.shape[0]+1, dtype=kern_ext.dtype)
+    bvec_ext[-1] = 1
+    return solve_lstsq(kern_ext, bvec_ext)
+
+
+sparse_solmethods = {'spsolve', 'gmres', 'bicgstab'}
+
+
+def solve_sparse(kern, bvec, solmethod='spsolve', tol=1e-12, maxiter=None, x0=None, ilu=None):
+    """
+    Solves the master equation with a sparse kernel using sparse LU decomposition
+    or preconditioned iterative methods.
+
+    Parameters
+    ----------
+    kern : scipy.sparse matrix
+        Square kernel matrix with one of the equations replaced by normalisation condition.
+    bvec : ndarray
+        Right hand side column vector for master equation.
+    solmethod : string
+        'spsolve' for sparse LU decomposition, 'gmres' or 'bicgstab' for
+        iterative methods preconditioned with incomplete LU decomposition.
+    tol : float
+        Relative tolerance for iterative methods.
+    maxiter : int
+        Maximal number of iterations for iterative methods.
+    x0 : ndarray
+        Initial guess for iterative methods.
+    ilu : scipy.sparse.linalg.SuperLU
+        Incomplete LU decomposition used as a preconditioner for iterative methods.
+        If None, it is calculated from kern.
+
+    Returns
+    -------
+    phi0 : ndarray
+        Solution of the master equation.
+    info : int
+        Convergence information. 0 means successful exit.
+    """
+    if solmethod not in sparse_solmethods:
+        raise ValueError('Unknown sparse solution method ' + str(solmethod) + '.')
+    kern = sparse.csc_matrix(kern)
+    if solmethod == 'spsolve':
+        return sparse_linalg.spsolve(kern, bvec), 0
+    #
+    ilu = sparse_linalg.spilu(kern) if ilu is None else ilu
+    precond = sparse_linalg.LinearOperator(kern.shape, ilu.solve)
+    if solmethod == 'gmres':
+        return sparse_linalg.gmres(kern, bvec, x0=x0, tol=tol, atol=0, maxiter=maxiter, M=precond)
+    else:
+        return sparse_linalg.bicgstab(kern, bvec, x0=x0, tol=tol, atol=0, maxiter=maxiter, M=precond)
+
+
+def ilu_reusable(kern, kern_ilu, rtol=0.1):
+    """
+    Checks if the incomplete LU decomposition of kern_ilu can be used as
+    a preconditioner for kern, i.e., if kern differs little from kern_ilu.
+
+    Parameters
+    ----------
+    kern : scipy.sparse matrix
+        New kernel matrix.
+    kern_ilu : scipy.sparse matrix or None
+        Kernel matrix, for which the incomplete LU decomposition was calculated.
+    rtol : float
+        Maximal allowed relative difference of the matrices in the Frobenius norm.
+
+    Returns
+    -------
+    bool
+        True if the preconditioner can be reused.
+    """
+    if kern_ilu is None or kern.shape != kern_ilu.shape:
+        return False
+    return sparse_linalg.norm(kern - kern_ilu) <= rtol*sparse_linalg.norm(kern_ilu)
+
+
+def replace_row_sparse(kern, row, vec):
+    """
+    Replaces a row of a sparse matrix by a given vector.
+
+    Parameters
+    ----------
+    kern : scipy.sparse matrix
+        Sparse matrix.
+    row : int
+        Index of the row, which is replaced. If row is equal to the number of rows,
+        vec is appended as an additional row.
+    vec : ndarray
+        Values of the new row.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Matrix with the replaced row.
+    """
+    kern = sparse.coo_matrix(kern)
+    keep = kern.row != row
+    cols = np.nonzero(vec)[0]
+    rows = np.concatenate((kern.row[keep], np.full(len(cols), row)))
+    cols, vals = np.concatenate((kern.col[keep], cols)), np.concatenate((kern.data[keep], vec[cols]))
+    shape = (max(kern.shape[0], row+1), kern.shape[1])
+    return sparse.csr_matrix((vals, (rows, cols)), shape=shape)
@@ -8,9 +8,14 @@ from __future__ import print_function
 
 from .specfunc import fermi_func
 from .specfunc import func_pauli
+from .specfunc import func_pauli_array
 from .specfunc import func_1vN
+from .specfunc import func_1vN_array
+from .specfunc import PrincipalValueTable
 from .specfunc import kernel_fredriksen
+from .specfunc import kernel_hilbert_grid
 from .specfunc import hilbert_fredriksen
+from .specfunc import HilbertTransform
 from .specfunc_elph import Func as pyFunc
 
 try:
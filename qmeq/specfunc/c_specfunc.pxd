@@ -11,4 +11,4 @@ cdef double_t fermi_func(double_t)
 cdef int_t func_pauli(double_t, double_t, double_t, double_t, double_t,
                       int_t, np.ndarray[double_t, ndim=1])
 cdef int_t func_1vN(double_t, double_t, double_t, double_t, double_t,
-                    int_t, int_t, np.ndarray[complex_t, ndim=1])
+                    int_t, int_t, np.ndarray[complex_t, ndim=1], double_t pv=*)
@@ -34,6 +34,8 @@ from libc.math cimport log
 # cdef extern from "math.h":
 #     double_t log(double_t)
 
+from libc.math cimport NAN, isnan
+
 
 @cython.cdivision(True)
 cdef double_t fermi_func(double_t x):
@@ -63,15 +65,19 @@ cdef int_t func_pauli(double_t Ecb, double_t mu, double_t T,
 cdef int_t func_1vN(double_t Ecb, double_t mu, double_t T,
                     double_t Dm, double_t Dp,
                     int_t itype, int_t limit,
-                    np.ndarray[complex_t, ndim=1] rez):
+                    np.ndarray[complex_t, ndim=1] rez,
+                    double_t pv=NAN):
     cdef double_t alpha, Rm, Rp, err
     cdef complex_t cur0, cur1, en0, en1, const0, const1
     # -------------------------
     if itype == 0:
         alpha, Rm, Rp = (Ecb-mu)/T, (Dm-mu)/T, (Dp-mu)/T
-        cur0, err = quad(fermi_func, Rm, Rp,
-                         weight='cauchy', wvar=alpha,
-                         epsabs=1.0e-6, epsrel=1.0e-6, limit=limit)
+        if isnan(pv):
+            cur0, err = quad(fermi_func, Rm, Rp,
+                             weight='cauchy', wvar=alpha,
+                             epsabs=1.0e-6, epsrel=1.0e-6, limit=limit)
+        else:
+            cur0 = pv
         cur0 = cur0 + (-1.0j*pi*fermi_func(alpha) if Rm < alpha < Rp else 0.0j)
         cur1 = cur0 + log(abs((Rm-alpha)/(Rp-alpha)))
         cur1 = cur1 + (1.0j*pi if Rm < alpha < Rp else 0.0j)
@@ -121,7 +127,7 @@ def c_func_pauli(double_t Ecb, double_t mu, double_t T,
 
 def c_func_1vN(double_t Ecb, double_t mu, double_t T,
                double_t Dm, double_t Dp,
-               int_t itype, int_t limit):
+               int_t itype, int_t limit, pv=None):
     rez = np.zeros(4, dtype=complexnp)
-    func_1vN(Ecb, mu, T, Dm, Dp, itype, limit, rez)
+    func_1vN(Ecb, mu, T, Dm, Dp, itype, limit, rez, NAN if pv is None else pv)
     return rez
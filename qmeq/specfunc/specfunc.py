@@ -4,15 +4,22 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import math
 import numpy as np
 from numpy.fft import fft, ifft
+from scipy import fft as scipy_fft
 from scipy import pi
 from scipy import log
 from scipy import exp
 from scipy.special import psi as digamma
+from scipy.special import expit
+from scipy.special import exp1
+from scipy.special import xlogy
 from scipy.integrate import quad
+from scipy.interpolate import CubicSpline
 
 from ..mytypes import doublenp
+from ..mytypes import complexnp
 
 
 def fermi_func(x):
@@ -56,7 +63,45 @@ def func_pauli(Ecb, mu, T, Dm, Dp, itype):
     return rez
 
 
-def func_1vN(Ecb, mu, T, Dm, Dp, itype, limit):
+def func_pauli_array(Ecb, mu, T, Dm, Dp, itype):
+    """
+    Vectorized version of func_pauli, which evaluates the current amplitudes
+    for all energies and all leads at once.
+
+    Parameters
+    ----------
+    Ecb : array
+        Array of energies.
+    mu : array
+        Chemical potentials of the leads.
+    T : array
+        Temperatures of the leads.
+    Dm,Dp : array
+        Bandwidths of the leads.
+    itype : int
+        Type of function calculation.
+
+    Returns
+    -------
+    ndarray
+        | nleads by len(Ecb) by 2 array containing
+          momentum-integrated current amplitudes.
+        | [..., 0] - particle current amplitude.
+        | [..., 1] - hole current amplitude.
+    """
+    Ecb = np.asarray(Ecb, dtype=doublenp)[np.newaxis, :]
+    mu, T, Dm, Dp = [np.asarray(x, dtype=doublenp).reshape(-1, 1) for x in (mu, T, Dm, Dp)]
+    alpha = (Ecb-mu)/T
+    rez = np.zeros(alpha.shape+(2,), dtype=doublenp)
+    rez[..., 0] = 2*pi*expit(-alpha)
+    rez[..., 1] = 2*pi*expit(alpha)
+    if not (itype == 1 or itype == 3):
+        Rm, Rp = (Dm-mu)/T, (Dp-mu)/T
+        rez[np.logical_not((Rm < alpha) & (alpha < Rp))] = 0
+    return rez
+
+
+def func_1vN(Ecb, mu, T, Dm, Dp, itype, limit, pv=None):
     """
     Function used when generating 1vN, Redfield approach kernel.
 
@@ -81,6 +126,9 @@ def func_1vN(Ecb, mu, T, Dm, Dp, itype, limit):
     limit : int
         For itype=0 dqawc_limit determines the maximum number of sub-intervals
         in the partition of the given integration interval.
+    pv : float
+        For itype=0 the value of the principal value integral, for example,
+        obtained from PrincipalValueTable. If None, it is evaluated using dqawc.
 
     Returns
     -------
@@ -94,9 +142,12 @@ def func_1vN(Ecb, mu, T, Dm, Dp, itype, limit):
     """
     if itype == 0:
         alpha, Rm, Rp = (Ecb-mu)/T, (Dm-mu)/T, (Dp-mu)/T
-        cur0, err = quad(fermi_func, Rm, Rp,
-                         weight='cauchy', wvar=alpha, epsabs=1.0e-6,
-                         epsrel=1.0e-6, limit=limit)
+        if pv is None:
+            cur0, err = quad(fermi_func, Rm, Rp,
+                             weight='cauchy', wvar=alpha, epsabs=1.0e-6,
+                             epsrel=1.0e-6, limit=limit)
+        else:
+            cur0 = pv
         cur0 = cur0 + (-1.0j*pi*fermi_func(alpha) if Rm < alpha < Rp else 0)
         cur1 = cur0 + log(abs((Rm-alpha)/(Rp-alpha)))
         cur1 = cur1 + (1.0j*pi if Rm < alpha < Rp else 0)
@@ -134,7 +185,246 @@ def func_1vN(Ecb, mu, T, Dm, Dp, itype, limit):
     return np.array([cur0, cur1, en0, en1])
 
 
-def kernel_fredriksen(n):
+def func_1vN_array(Ecb, mu, T, Dm, Dp, itype, limit, pv=None):
+    """
+    Vectorized version of func_1vN, which evaluates the current amplitudes
+    for all energies and all leads at once.
+
+    Parameters
+    ----------
+    Ecb : array
+        Array of energies.
+    mu : array
+        Chemical potentials of the leads.
+    T : array
+        Temperatures of the leads.
+    Dm,Dp : array
+        Bandwidths of the leads.
+    itype : int
+        Type of integral for first order approach calculations. See func_1vN.
+    limit : int
+        For itype=0 dqawc_limit determines the maximum number of sub-intervals
+        in the partition of the given integration interval.
+    pv : array
+        For itype=0 nleads by len(Ecb) array of the principal value integrals.
+        If None, they are evaluated using dqawc.
+
+    Returns
+    -------
+    ndarray
+        | nleads by len(Ecb) by 4 array containing momentum-integrated current amplitudes.
+        | [..., 0] - particle current amplitude.
+        | [..., 1] - hole current amplitude.
+        | [..., 2] - particle energy current amplitude.
+        | [..., 3] - hole energy current amplitude.
+    """
+    Ecb = np.asarray(Ecb, dtype=doublenp)[np.newaxis, :]
+    mu, T, Dm, Dp = [np.asarray(x, dtype=doublenp).reshape(-1, 1) for x in (mu, T, Dm, Dp)]
+    alpha = (Ecb-mu)/T
+    rez = np.zeros(alpha.shape+(4,), dtype=complexnp)
+    if itype == 0:
+        Rm, Rp = (Dm-mu)/T, (Dp-mu)/T
+        inband = (Rm < alpha) & (alpha < Rp)
+        if pv is None:
+            pv = np.zeros(alpha.shape, dtype=doublenp)
+            for l, i in np.ndindex(alpha.shape):
+                pv[l, i], err = quad(fermi_func, Rm[l, 0], Rp[l, 0],
+                                     weight='cauchy', wvar=alpha[l, i], epsabs=1.0e-6,
+                                     epsrel=1.0e-6, limit=limit)
+        cur0 = pv + np.where(inband, -1.0j*pi*expit(-alpha), 0)
+        cur1 = cur0 + np.log(np.abs((Rm-alpha)/(Rp-alpha))) + np.where(inband, 1.0j*pi, 0)
+        const0 = T*(np.where(Rm < -40, -Rm, np.log(1+np.exp(-np.maximum(Rm, -40)))) -
+                    np.where(Rp < -40, -Rp, np.log(1+np.exp(-np.maximum(Rp, -40)))))
+        const1 = const0 + Dm-Dp
+        rez[..., 2] = const0 + Ecb*cur0
+        rez[..., 3] = const1 + Ecb*cur1
+    elif itype == 1:
+        Rm, Rp = Dm/T, Dp/T
+        cur0 = digamma(0.5+1.0j*alpha/(2*pi)).real - np.log(np.abs(Rm)/(2*pi))
+        cur0 = cur0 - 1.0j*pi*expit(-alpha)
+        cur1 = cur0 + np.log(np.abs(Rm/Rp)) + 1.0j*pi
+        rez[..., 2] = -T*Rm + Ecb*cur0
+        rez[..., 3] = -T*Rp + Ecb*cur1
+    elif itype == 2:
+        Rm, Rp = (Dm-mu)/T, (Dp-mu)/T
+        inband = (Rm < alpha) & (alpha < Rp)
+        cur0 = np.where(inband, -1.0j*pi*expit(-alpha), 0)
+        cur1 = cur0 + np.where(inband, 1.0j*pi, 0)
+        rez[..., 2] = Ecb*cur0
+        rez[..., 3] = Ecb*cur1
+    elif itype == 3:
+        cur0 = -1.0j*pi*expit(-alpha)
+        cur1 = cur0 + 1.0j*pi
+        rez[..., 2] = Ecb*cur0
+        rez[..., 3] = Ecb*cur1
+    else:
+        return rez
+    rez[..., 0] = cur0
+    rez[..., 1] = cur1
+    return rez
+
+
+def fermi_func_expit(x):
+    """Fermi function, which does not overflow for large x."""
+    return expit(-x)
+
+
+def exp1_scaled(z):
+    """Exponential integral E1(z) multiplied by exp(z) for positive z."""
+    z = np.asarray(z, dtype=doublenp)
+    rez = np.zeros(z.shape, dtype=doublenp)
+    small = z < 700
+    rez[small] = np.exp(z[small])*exp1(z[small])
+    zl = z[np.logical_not(small)]
+    rez[np.logical_not(small)] = (1-1/zl+2/zl**2)/zl
+    return rez
+
+
+def fermi_func_math(x):
+    """Fermi function for a scalar x, which does not overflow for large x."""
+    return 1/(math.exp(x)+1) if x < 700 else 0.0
+
+
+def log_cosh(x):
+    """Logarithm of cosh(x) for a scalar x, which does not overflow for large x."""
+    x = abs(x)
+    return x + math.log1p(math.exp(-2*x)) - math.log(2)
+
+
+def log_sinhc(x):
+    """Logarithm of sinh(x)/x for a scalar x, which does not overflow for large x."""
+    x = abs(x)
+    if x < 1:
+        return math.log(math.sinh(x)/x) if x != 0 else 0.0
+    return x + math.log1p(-math.exp(-2*x)) - math.log(2*x)
+
+
+class PrincipalValueTable(object):
+    """
+    Class for evaluating the principal value integral
+
+    I(alpha) = P int_{Rm}^{Rp} dx f(x)/(x-alpha),
+
+    where f(x) is the Fermi function and Rm=(Dm-mu)/T, Rp=(Dp-mu)/T are the reduced band edges.
+    The integral is needed by func_1vN for itype=0.
+
+    For a wide band Rm < -rcut, Rp > rcut the integral is given by
+    Re[digamma(1/2+1j*alpha/(2*pi))] - log(abs(Rm-alpha)/(2*pi)) minus the contributions of the
+    Fermi function tails outside of the band, which are expanded in exp(-k*abs(R)) using the exponential
+    integral E1. Otherwise the smooth function S(alpha) = I(alpha) - f(alpha)*log(abs((Rp-alpha)/(alpha-Rm)))
+    is tabulated in the band Rm < alpha < Rp on nodes equidistant in arcsinh(alpha) and interpolated
+    by a cubic spline. The number of nodes is doubled until the spline agrees with the integrals
+    at the midpoints within tol. Outside of the band, for tableq=False, or when the tolerance is
+    not reached with nmax nodes the integral is evaluated by QUADPACK routine dqawc.
+
+    Because f(-x) = 1-f(x), the table also gives the integral for the reflected band edges -Rp, -Rm,
+    see reflected().
+
+    Attributes
+    ----------
+    Rm, Rp : float
+        Reduced band edges.
+    limit : int
+        dqawc_limit used for the integrals evaluated by dqawc.
+    wideq : bool
+        Indicates if the wide band expression is used.
+    spline : CubicSpline
+        Spline of S(alpha) as a function of arcsinh(alpha).
+        None if the spline was not made or the tolerance was not reached.
+    """
+
+    def __init__(self, Rm, Rp, limit=10000, tableq=True, tol=1.0e-8, rcut=10.0, nmin=33, nmax=4097):
+        self.Rm, self.Rp, self.limit = Rm, Rp, limit
+        self.wideq = tableq and Rm < -rcut and Rp > rcut
+        self.spline = None
+        if tableq and not self.wideq:
+            self.make_spline(tol, nmin, nmax)
+
+    def get_wide(self, alpha):
+        """Evaluates the integral for a wide band and Rm < alpha < Rp."""
+        Rm, Rp = self.Rm, self.Rp
+        rez = digamma(0.5+1.0j*alpha/(2*pi)).real - np.log(np.abs(Rm-alpha)/(2*pi))
+        k = np.arange(1, 4)[:, None]
+        tails = (np.exp(k*Rm)*exp1_scaled(k*(alpha-Rm)) + np.exp(-k*Rp)*exp1_scaled(k*(Rp-alpha)))
+        rez -= np.dot(np.array([1., -1., 1.]), tails)
+        return rez
+
+    def get_smooth(self, alpha):
+        """
+        Evaluates S(alpha) by integrating the regular integrand
+        (f(x)-f(alpha))/(x-alpha) = -sinh(h)/h/(4*cosh(x/2)*cosh(alpha/2)), h=(x-alpha)/2,
+        which is evaluated without cancellations and overflows.
+        """
+        lca = log_cosh(0.5*alpha)
+
+        def integrand(x):
+            return -0.25*math.exp(log_sinhc(0.5*(x-alpha)) - log_cosh(0.5*x) - lca)
+        val, err = quad(integrand, self.Rm, self.Rp, epsabs=1.0e-12, epsrel=1.0e-12, limit=self.limit)
+        return val
+
+    def make_spline(self, tol, nmin, nmax):
+        """Makes the spline of S(alpha) with nodes doubled until the tolerance tol is reached."""
+        u = np.linspace(np.arcsinh(self.Rm), np.arcsinh(self.Rp), nmin)
+        vals = np.array([self.get_smooth(np.sinh(ui)) for ui in u])
+        while len(u) <= nmax:
+            um = 0.5*(u[1:]+u[:-1])
+            valsm = np.array([self.get_smooth(np.sinh(ui)) for ui in um])
+            err = np.max(np.abs(CubicSpline(u, vals)(um) - valsm))
+            # Merge the nodes and the midpoints
+            un, valsn = np.zeros(2*len(u)-1), np.zeros(2*len(u)-1)
+            un[0::2], un[1::2] = u, um
+            valsn[0::2], valsn[1::2] = vals, valsm
+            u, vals = un, valsn
+            if err < tol:
+                self.spline = CubicSpline(u, vals)
+                return
+
+    def quad(self, alpha):
+        """Evaluates the integral by dqawc in the same way as func_1vN."""
+        val, err = quad(fermi_func_math, self.Rm, self.Rp,
+                        weight='cauchy', wvar=alpha, epsabs=1.0e-6,
+                        epsrel=1.0e-6, limit=self.limit)
+        return val
+
+    def __call__(self, alpha):
+        """
+        Evaluates the principal value integral.
+
+        Parameters
+        ----------
+        alpha : array
+            Array of energies alpha=(Ecb-mu)/T.
+
+        Returns
+        -------
+        array
+            Values of the integral.
+        """
+        alpha = np.asarray(alpha, dtype=doublenp)
+        Rm, Rp = self.Rm, self.Rp
+        rez = np.zeros(alpha.shape, dtype=doublenp)
+        inband = (Rm < alpha) & (alpha < Rp)
+        a = alpha[inband]
+        if self.wideq:
+            rez[inband] = self.get_wide(a)
+        elif self.spline is not None:
+            rez[inband] = self.spline(np.arcsinh(a)) + fermi_func_expit(a)*np.log(np.abs((Rp-a)/(a-Rm)))
+        else:
+            inband[:] = False
+        outband = np.logical_not(inband)
+        rez[outband] = [self.quad(a) for a in alpha[outband]]
+        return rez
+
+    def reflected(self, alpha):
+        """
+        Evaluates the principal value integral for the reflected band edges -Rp, -Rm
+        using P int_{-Rp}^{-Rm} dx f(x)/(x-alpha) = log(abs((Rm+alpha)/(Rp+alpha))) + I(-alpha).
+        """
+        alpha = np.asarray(alpha, dtype=doublenp)
+        return np.log(np.abs((self.Rm+alpha)/(self.Rp+alpha))) + self(-alpha)
+
+
+def kernel_fredriksen(n, m=None):
     """
     Generates kernel for Hilbert transform using FFT.
 
@@ -142,6 +432,9 @@ def kernel_fredriksen(n):
     ----------
     n : int
         Number of equidistant grid points.
+    m : int
+        Length of the zero padded grid, which has to be at least 2*n-1.
+        By default m=2*n.
 
     Returns
     -------
@@ -149,16 +442,51 @@ def kernel_fredriksen(n):
         Kernel used when performing Hilbert transform using FFT.
     """
     aux = np.zeros(n+1, dtype=doublenp)
-    for i in range(1, n+1):
-        aux[i] = i*log(i)
-    m = 2*n
+    i = np.arange(1, n+1)
+    aux[1:] = i*np.log(i)
+    m = 2*n if m is None else m
     ker = np.zeros(m, dtype=doublenp)
-    for i in range(1, n):
-        ker[i] = aux[i+1]-2*aux[i]+aux[i-1]
-        ker[m-i] = -ker[i]
+    ker[1:n] = aux[2:n+1]-2*aux[1:n]+aux[0:n-1]
+    ker[m-n+1:] = -ker[n-1:0:-1]
     return fft(ker)/pi
 
 
+def kernel_hilbert_grid(grid, block=256):
+    """
+    Generates matrix for Hilbert transform on a non-equidistant grid.
+
+    The function is linearly interpolated between the grid points and is zero beyond
+    one more grid step at the edges, as in kernel_fredriksen, to which the matrix
+    reduces for an equidistant grid. The matrix is dense, so it takes 8*len(grid)**2 bytes.
+    It is generated in blocks of rows, which keeps the temporary arrays small.
+
+    Parameters
+    ----------
+    grid : ndarray
+        Increasing grid points.
+    block : int
+        Number of rows generated at once.
+
+    Returns
+    -------
+    ndarray
+        len(grid) by len(grid) matrix, which multiplied by the function values
+        on the grid gives the Hilbert transform on the grid.
+    """
+    n = len(grid)
+    nodes = np.concatenate(([2*grid[0]-grid[1]], grid, [2*grid[-1]-grid[-2]]))
+    dnodes = np.diff(nodes)
+    matrix = np.empty((n, n), dtype=doublenp)
+    for i in range(0, n, block):
+        u = grid[i:i+block, None] - nodes[None, :]
+        g = xlogy(u, np.abs(u))
+        slope = np.subtract(g[:, 0:-1], g[:, 1:], out=u[:, 0:-1])
+        slope /= dnodes
+        np.subtract(slope[:, 0:-1], slope[:, 1:], out=matrix[i:i+block])
+    matrix /= pi
+    return matrix
+
+
 def hilbert_fredriksen(f, ker=None):
     """
     Performs Hilbert transform of f.
@@ -181,3 +509,106 @@ def hilbert_fredriksen(f, ker=None):
     fpad = fft(np.concatenate((f, np.zeros(len(ker)-n))))
     r = ifft(fpad*ker)
     return r[0:n]
+
+
+class HilbertTransform(object):
+    """
+    Class for performing Hilbert transforms of arrays along the first axis using FFT.
+    The transform is the same as in hilbert_fredriksen, but all columns are transformed
+    by one, optionally multithreaded, FFT of a zero padded grid having fast FFT length.
+    Real input is transformed using real FFT. The kernels are cached by the length of
+    the grid and the zero padded input buffers by the shape of the array.
+
+    Attributes
+    ----------
+    workers : int
+        Default number of workers used by scipy.fft. Negative values count from the number of CPUs.
+        The default is one worker, so that the transforms do not oversubscribe the processors
+        used by parallel sweeps or OpenMP threads.
+    kernels : dict
+        Kernels generated using kernel_fredriksen(n, m) keyed by (n, m).
+    buffers : dict
+        Zero padded input buffers keyed by shape and type of the input.
+    grid, matrix : ndarray
+        The last non-equidistant grid and its matrix generated using kernel_hilbert_grid(grid).
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.kernels = {}
+        self.buffers = {}
+        self.grid, self.matrix = None, None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The caches are regenerated when needed
+        state['kernels'], state['buffers'] = {}, {}
+        state['grid'], state['matrix'] = None, None
+        return state
+
+    def get_kernel(self, n, m):
+        """Returns the cached kernel for n grid points zero padded to length m."""
+        ker = self.kernels.get((n, m))
+        if ker is None:
+            ker = kernel_fredriksen(n, m)
+            self.kernels[(n, m)] = ker
+        return ker
+
+    def get_matrix(self, grid):
+        """Returns the matrix for the non-equidistant grid, which is cached for the last grid."""
+        if self.grid is None or not np.array_equal(self.grid, grid):
+            self.grid, self.matrix = np.array(grid, dtype=doublenp), kernel_hilbert_grid(grid)
+        return self.matrix
+
+    def __call__(self, f, out=None, grid=None, workers=None):
+        """
+        Performs Hilbert transform of f along the first axis.
+
+        Parameters
+        ----------
+        f : ndarray
+            Values of functions on a grid, which is enumerated by the first axis.
+        out : ndarray
+            (Modifies) If given, the Hilbert transform is written into this array.
+        grid : ndarray
+            Non-equidistant grid, on which the transform is performed by a matrix product.
+            By default the grid is equidistant and FFT is used.
+        workers : int
+            Number of workers used by scipy.fft. By default self.workers is used.
+
+        Returns
+        -------
+        ndarray
+            Hilbert transform of f, which is real for real f.
+        """
+        n = f.shape[0]
+        if grid is not None:
+            r = np.dot(self.get_matrix(grid), np.reshape(f, (n, -1)))
+            if out is None:
+                out = np.empty(f.shape, dtype=r.dtype)
+            out[...] = r.reshape(f.shape)
+            return out
+        workers = self.workers if workers is None else workers
+        realq = not np.iscomplexobj(f)
+        m = scipy_fft.next_fast_len(2*n, real=realq)
+        # The columns are transformed along the contiguous last axis of the buffer
+        fcols = np.reshape(f, (n, -1)).T
+        key = (fcols.shape, m, f.dtype.char)
+        fpad = self.buffers.get(key)
+        if fpad is None:
+            fpad = np.zeros((fcols.shape[0], m), dtype=f.dtype)
+            self.buffers[key] = fpad
+        fpad[:, 0:n] = fcols
+        ker = self.get_kernel(n, m)
+        if realq:
+            r = scipy_fft.rfft(fpad, axis=-1, workers=workers)
+            r *= ker[0:m//2+1]
+            r = scipy_fft.irfft(r, n=m, axis=-1, overwrite_x=True, workers=workers)
+        else:
+            r = scipy_fft.fft(fpad, axis=-1, workers=workers)
+            r *= ker
+            r = scipy_fft.ifft(r, axis=-1, overwrite_x=True, workers=workers)
+        if out is None:
+            out = np.empty(f.shape, dtype=r.dtype)
+        out[...] = r[:, 0:n].T.reshape(f.shape)
+        return out
@@ -1,5 +1,6 @@
 import numpy as np
 from numpy.linalg import norm
+from scipy.sparse import issparse
 from qmeq.builder import *
 import qmeq
 import itertools
@@ -121,6 +122,8 @@ def test_Builder_double_dot_spinful():
 
         system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
                          kerntype=kerntype, itype=itype)
+        # The data for itype=0 were calculated by dqawc for each transition
+        system.pv_tableq = False
         system.solve()
         attr = kerntype+str(itype)
         setattr(calcs, attr, system)
@@ -137,6 +140,29 @@ def test_Builder_double_dot_spinful():
         assert norm(system.current - data[attr+'current']) < EPS
         assert norm(system.energy_current - data[attr+'energy_current']) < EPS
 
+    # Check principal value integrals for itype=0 given by the wide band expression
+    # and by the spline tables, which are reused for the reflected band edges
+    for kerntype, pv_rcut in itertools.product(['Redfield', '1vN', 'pyRedfield', 'py1vN'], [10.0, 100.0]):
+        system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                         kerntype=kerntype, itype=0)
+        system.funcp.pv_rcut, system.funcp.pv_table_nmin = pv_rcut, 0
+        system.solve()
+        assert len(system.funcp.pv_tables) == (0 if pv_rcut == 10.0 else 1)
+        for param in ['current', 'energy_current']:
+            assert norm(getattr(system, param) - data[kerntype.replace('py', '')+'0'+param]) < 1e-8
+
+    # The spline tables are made only for many transitions and the least recently used one is removed
+    funcp = system.funcp
+    funcp.pv_tables, funcp.pv_tables_size, funcp.pv_table_nmin = {}, 2, 10
+    assert funcp.get_pv_table(0., 1., -5., 5., 9)[0].spline is None
+    assert len(funcp.pv_tables) == 0
+    table0 = funcp.get_pv_table(0., 1., -5., 5., 10)[0]
+    table1 = funcp.get_pv_table(1., 1., -5., 5., 10)[0]
+    assert funcp.get_pv_table(-1., 1., -5., 5., 0) == (table1, True)
+    assert funcp.get_pv_table(0., 1., -5., 5., 0) == (table0, False)
+    funcp.get_pv_table(2., 1., -5., 5., 10)
+    assert list(funcp.pv_tables) == [(-5., 5., funcp.dqawc_limit), (-7., 3., funcp.dqawc_limit)]
+
     # Check least-squares solution with non-square matrix, i.e., symq=False
     for kerntype in kerns:
         system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
@@ -146,6 +172,32 @@ def test_Builder_double_dot_spinful():
         for param in ['current', 'energy_current']:
             assert norm(getattr(system, param) - getattr(getattr(calcs, attr), param)) < EPS
 
+    # Check vectorized Python Pauli factors against Cython ones
+    for indexing in ['Lin', 'charge', 'sz', 'ssq']:
+        systems = [Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                           kerntype=kerntype, itype=2, indexing=indexing) for kerntype in ['Pauli', 'pyPauli']]
+        for system in systems:
+            system.solve()
+        assert norm(systems[0].appr.paulifct - systems[1].appr.paulifct) < EPS
+        assert norm(systems[0].current - systems[1].current) < EPS
+
+    # Check Python kernels assembled from plans against Cython kernels
+    for kerntype, indexing in itertools.product(['Pauli', 'Redfield', '1vN', 'Lindblad'], ['Lin', 'ssq']):
+        systems = [Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                           kerntype=k, itype=2, indexing=indexing) for k in [kerntype, 'py'+kerntype]]
+        for system in systems:
+            system.solve()
+        assert norm(systems[0].appr.kern - systems[1].appr.kern) < EPS
+        # The plan is reused and remade when the indexing changes
+        plans = dict(systems[1].si.plans)
+        systems[1].solve()
+        assert len(plans) == 1 and all(systems[1].si.plans[key] is plans[key] for key in plans)
+        for system in systems:
+            system.remove_coherences(10.0)
+            system.solve()
+        assert len(systems[1].si.plans) == 1 and systems[1].si.plans != plans
+        assert norm(systems[0].appr.kern - systems[1].appr.kern) < EPS
+
     # Check matrix-free methods
     kerns = ['Pauli', 'Redfield', '1vN', 'Lindblad']
     kerns += ['pyPauli', 'pyRedfield', 'py1vN', 'pyLindblad'] if CHECK_PY else []
@@ -169,6 +221,71 @@ def test_Builder_double_dot_spinful():
         for param in ['current', 'energy_current']:
             assert norm(getattr(system, param) - getattr(getattr(calcs, attr), param)) < EPS
 
+    # Check block-tridiagonal solution of Pauli kernel
+    kerns = ['Pauli']
+    kerns += ['pyPauli'] if CHECK_PY else []
+    for kerntype, indexing in itertools.product(kerns, indexings):
+        system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                         kerntype=kerntype, itype=2, indexing=indexing, solmethod='block')
+        system.solve()
+        attr = kerntype+str(itype)
+        assert system.appr.kern_blocks is not None
+        assert system.appr.residual < EPS
+        for param in ['current', 'energy_current']:
+            assert norm(getattr(system, param) - getattr(getattr(calcs, attr), param)) < EPS
+
+    # Approaches without block kernel fall back to solmethod=solve only for the current solve
+    system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                     kerntype='1vN', itype=2, solmethod='block')
+    system.solve()
+    assert system.funcp.solmethod == 'block'
+    for param in ['current', 'energy_current']:
+        assert norm(getattr(system, param) - getattr(getattr(calcs, '1vN2'), param)) < EPS
+
+    # Singular block of a charge sector without outflow falls back to the dense kernel
+    for kerntype in kerns:
+        system = Builder(nsingle=1, hsingle={(0, 0): 5000.}, nleads=2, tleads={(0, 0): 1., (1, 0): 1.},
+                         mulst={0: 0., 1: 0.}, tlst={0: 0.1, 1: 0.1}, dband={0: 1e4, 1: 1e4},
+                         kerntype=kerntype, solmethod='block')
+        system.solve()
+        assert system.appr.success
+        assert system.funcp.solmethod == 'block'
+        assert norm(system.phi0 - [1, 0]) < EPS
+
+    # Check sparse kernels with sparse direct and iterative solution methods
+    kerns = ['Pauli', 'Redfield', '1vN', 'Lindblad']
+    kerns += ['pyPauli', 'pyRedfield', 'py1vN', 'pyLindblad'] if CHECK_PY else []
+    solmethods = ['spsolve', 'gmres', 'bicgstab']
+    for kerntype, solmethod, symq in itertools.product(kerns, solmethods, [True, False]):
+        system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                         kerntype=kerntype, itype=2, solmethod=solmethod, symq=symq)
+        system.solve()
+        attr = kerntype+str(itype)
+        assert issparse(system.appr.kern)
+        for param in ['current', 'energy_current']:
+            assert norm(getattr(system, param) - getattr(getattr(calcs, attr), param)) < EPS
+
+    # Check QR least squares and LU null vector solution methods
+    kerns = ['Pauli', 'Redfield', '1vN', 'Lindblad']
+    kerns += ['pyPauli', 'pyRedfield', 'py1vN', 'pyLindblad'] if CHECK_PY else []
+    for kerntype, solmethod, symq in itertools.product(kerns, ['qr', 'lu'], [True, False]):
+        system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                         kerntype=kerntype, itype=2, solmethod=solmethod, symq=symq)
+        system.solve()
+        attr = kerntype+str(itype)
+        assert system.appr.residual < EPS
+        assert 1 <= system.appr.cond < np.inf
+        for param in ['current', 'energy_current']:
+            assert norm(getattr(system, param) - getattr(getattr(calcs, attr), param)) < EPS
+
+    # A failed solution has the length of the kernel
+    system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, {}, p.mulst, p.tlst, p.dlst,
+                     kerntype='Pauli', itype=2)
+    system.solve()
+    assert not system.appr.success
+    assert len(system.phi0) == system.si.npauli
+    assert system.appr.residual == 0
+
 
 def test_Builder_double_dot_spinless_2vN():
     data_current = {'2vN': [0.18472226147540757, -0.1847222614754047]}
@@ -185,6 +302,213 @@ def test_Builder_double_dot_spinless_2vN():
         assert norm(system.current - data_current['2vN']) < EPS
         assert norm(system.energy_current - data_energy_current['2vN']) < EPS
 
+    # The energy grid points are distributed among several threads
+    system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                     kerntype='2vN', kpnt=p.kpnt)
+    system.nthreads = 3
+    system.solve(niter=5)
+    assert system.funcp.nthreads == 3
+    assert norm(system.current - data_current['2vN']) < EPS
+    assert norm(system.energy_current - data_energy_current['2vN']) < EPS
+
+
+def test_Builder_2vN_convergence():
+    p = ParametersDoubleDotSpinless()
+    system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                     kerntype='2vN', kpnt=p.kpnt)
+    system.solve(niter=60)
+    current = system.current
+    #
+    system.solve(tol=1e-10)
+    niter = system.niter
+    assert system.converged
+    assert system.iters[0].dcurrent == np.inf
+    assert system.iters[-1].dcurrent < 1e-10 and system.iters[-1].dphi0 < 1e-10
+    assert norm(system.current - current) < 1e-9
+    # Anderson mixing converges in fewer iterations
+    system.solve(tol=1e-10, anderson=5)
+    assert system.appr.converged and system.niter < niter/2
+    assert norm(system.current - current) < 1e-9
+    # Plain iterations can be continued after the mixing
+    system.solve(qdq=False, restartq=False, niter=2)
+    assert system.iters[-1].dcurrent < 1e-10
+    #
+    system.solve(tol=1e-10, maxiter=2)
+    assert not system.appr.converged and system.niter == 1
+
+
+def test_Builder_2vN_memory():
+    p = ParametersDoubleDotSpinless()
+    kerns = ['2vN']
+    kerns += ['py2vN'] if CHECK_PY else []
+    for kerntype in kerns:
+        system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                         kerntype=kerntype, kpnt=p.kpnt)
+        system.solve(niter=10)
+        current, peak_memory = system.current, system.appr.peak_memory
+        assert len(system.iters) == 10 and peak_memory >= system.appr.memory > 0
+        # Single precision storage
+        system.mtype_2vN = np.complex64
+        system.solve(niter=10)
+        assert system.appr.phi1k.dtype == np.complex64
+        assert norm(system.current - current) < 1e-6
+        assert system.appr.peak_memory < 0.7*peak_memory
+        # Bounded history
+        system.mtype_2vN, system.iters_size = complex, 3
+        system.solve(niter=10)
+        assert len(system.iters) == 3 and system.iters[-1].niter == 9
+        assert norm(system.current - current) < EPS
+        system.iters_size = 0
+        system.solve(tol=1e-8)
+        assert system.iters == [] and system.appr.converged
+        assert system.appr.last_iter.dcurrent < 1e-8
+
+
+def test_Builder_2vN_adaptive_grid():
+    p = ParametersDoubleDotSpinless()
+    hsingle, tleads = {(0,0): -10, (1,1): -12, (0,1): 5}, {(0,0): 0.4, (1,1): 0.3}
+    tlst, dlst = [0.5, 0.5], [60.0, 60.0]
+
+    def solve(kpnt, grid_2vN, grid_fct=0.3, kerntype='2vN'):
+        system = Builder(p.nsingle, hsingle, p.coulomb, p.nleads, tleads, p.mulst, tlst, dlst,
+                         kerntype=kerntype, kpnt=kpnt)
+        system.grid_2vN, system.grid_fct = grid_2vN, grid_fct
+        system.solve(tol=1e-10, maxiter=300, anderson=5)
+        return system
+    current = solve(2048, 'uniform').current
+    system = solve(128, 'adaptive')
+    Ek_grid = system.appr.Ek_grid
+    assert len(Ek_grid) == 128 and Ek_grid[0] == -60.0 and Ek_grid[-1] == 60.0
+    assert np.all(np.diff(Ek_grid) > 0) and np.max(np.diff(Ek_grid)) > 10*np.min(np.diff(Ek_grid))
+    # The dense Hilbert transform matrix is included in the memory
+    matrix = system.funcp.htransf.matrix
+    assert matrix.shape == (len(system.appr.Ek_grid_ext),)*2 and system.appr.memory > matrix.nbytes
+    # The adaptive grid is more accurate than the uniform grid with the same number of points
+    assert norm(system.current - current) < 0.2*norm(solve(128, 'uniform').current - current)
+    if CHECK_PY:
+        assert norm(solve(128, 'adaptive', kerntype='py2vN').current - system.current) < EPS
+    # Adaptive grid with all points distributed uniformly
+    assert norm(solve(128, 'adaptive', grid_fct=1.0).current - solve(128, 'uniform').current) < EPS
+
+
+def test_Builder_2vN_checkpoint(tmp_path):
+    p = ParametersDoubleDotSpinless()
+    filename = str(tmp_path / 'checkpoint.npz')
+
+    def make_system():
+        return Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                       kerntype='2vN', kpnt=p.kpnt)
+    for anderson, grid_2vN, mtype_2vN in [(0, 'uniform', complex), (4, 'adaptive', np.complex64)]:
+        system = make_system()
+        system.grid_2vN, system.mtype_2vN = grid_2vN, mtype_2vN
+        system.solve(niter=9, anderson=anderson)
+        current, phi1k = system.current, system.appr.phi1k
+        # Interrupted calculation is saved every 3 iterations and at the end
+        system = make_system()
+        system.grid_2vN, system.mtype_2vN = grid_2vN, mtype_2vN
+        system.solve(niter=4, anderson=anderson, checkpoint=filename, checkpoint_step=3)
+        system = make_system()
+        system.load_checkpoint(filename)
+        assert system.niter == 3 and system.grid_2vN == grid_2vN
+        assert np.dtype(system.mtype_2vN) == np.dtype(mtype_2vN)
+        system.solve(niter=1, anderson=anderson, restartq=False, checkpoint=filename)
+        # Resumed calculation
+        system = make_system()
+        system.load_checkpoint(filename)
+        assert system.niter == 4 and len(system.iters) == 1
+        system.solve(niter=4, anderson=anderson, restartq=False)
+        assert system.niter == 8
+        assert norm(system.current - current) < EPS
+        assert norm(system.appr.phi1k - phi1k) < EPS
+
+
+def test_Builder_2vN_fk_tables():
+    p = ParametersDoubleDotSpinless()
+    system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                     kerntype='2vN', kpnt=p.kpnt)
+    system.solve(niter=3)
+    Ek_grid_ext, fkp = system.appr.Ek_grid_ext, system.appr.fkp
+    # Gate voltage sweep reuses the extended grid and the Fermi functions
+    hsingle = {(0,0): p.hsingle[(0,0)]-1, (1,1): p.hsingle[(1,1)]-1, (0,1): p.hsingle[(0,1)]}
+    system.change(hsingle=hsingle)
+    system.solve(niter=3)
+    assert system.appr.Ek_grid_ext is Ek_grid_ext and system.appr.fkp is fkp
+    assert len(system.funcp.fk_tables) == 1
+    system_ref = Builder(p.nsingle, hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                         kerntype='2vN', kpnt=p.kpnt)
+    system_ref.solve(niter=3)
+    assert norm(system.current - system_ref.current) < 1e-10
+    # Changed bias generates new Fermi functions and the least recently used ones are removed
+    system.funcp.fk_tables_size = 2
+    for mulst in [[1.0, -1.0], p.mulst, [2.0, -2.0]]:
+        system.change(mulst=mulst)
+        system.solve(niter=1)
+    assert len(system.funcp.fk_tables) == 2
+    system.change(mulst=p.mulst)
+    system.solve(niter=1)
+    assert system.appr.fkp is fkp
+
+
+def test_Builder_2vN_multigrid():
+    p = ParametersDoubleDotSpinless()
+    kpnt = 1024
+    system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                     kerntype='2vN', kpnt=kpnt)
+    system.solve(tol=1e-8, maxiter=100)
+    current_ref, niter_ref = system.current, system.niter
+    kpnts = []
+    system.solve(tol=1e-8, maxiter=100, multigrid=3, func_iter=lambda appr: kpnts.append(appr.funcp.kpnt))
+    assert system.appr.converged
+    assert [kpnts.count(k) for k in [kpnt//8, kpnt//4, kpnt//2]] == [4, 4, 4]
+    # Fewer iterations are needed on the finest grid
+    assert kpnts.count(kpnt) == system.niter+1 < niter_ref+1
+    assert system.funcp.kpnt == kpnt and len(system.appr.Ek_grid) == kpnt
+    assert norm(system.current - current_ref) < 1e-8
+
+
+def test_phi1k_local_2vN_array():
+    from qmeq.approach.base.neumann2 import phi1k_local_2vN, phi1k_local_2vN_array, kern1_lu_solve_2vN
+    p = ParametersSingleOrbitalSpinful()
+    system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                     kerntype='2vN', kpnt=p.kpnt)
+    system.solve(niter=1)
+    appr = system.appr
+    kern0, kern1k_lu = phi1k_local_2vN_array(appr)
+    eye = np.broadcast_to(np.eye(appr.si.ndm1), (p.kpnt, appr.si.ndm1, appr.si.ndm1))
+    kern1_inv = kern1_lu_solve_2vN(kern1k_lu, eye, appr.si)
+    for j1 in [0, 1, p.kpnt//2, p.kpnt-1]:
+        kern0_ref, kern1_inv_ref = phi1k_local_2vN(j1+appr.funcp.kpnt_left, appr.Ek_grid_ext, appr.fkp,
+                                                   appr.hfkp, appr.hfkm, appr.qd.Ea, appr.leads.Tba, appr.si)
+        assert norm(kern0[j1] - kern0_ref) < EPS
+        for l in range(p.nleads):
+            assert norm(kern1_inv[j1] - kern1_inv_ref[l]) < EPS
+
+
+def test_phi1k_iterate_2vN_array():
+    from qmeq.approach.base.neumann2 import phi1k_local_2vN, phi1k_iterate_2vN, phi1k_iterate_2vN_array
+    from qmeq.approach.base.neumann2 import get_htransf_phi1k, get_grid_htransf
+    p = ParametersDoubleDotSpinless()
+    for grid_2vN in ['uniform', 'adaptive']:
+        system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                         kerntype='py2vN', kpnt=p.kpnt)
+        system.funcp.grid_2vN = grid_2vN
+        system.solve(niter=2)
+        appr = system.appr
+        phi1k, hphi1k = get_htransf_phi1k(appr.phi1k_delta, appr.funcp, grid=get_grid_htransf(appr))
+        phi1k_delta = phi1k_iterate_2vN_array(appr, phi1k, hphi1k)
+        shift_tables = appr.shift_tables
+        for j1 in [0, 1, p.kpnt//2, p.kpnt-1]:
+            ind = j1+appr.funcp.kpnt_left
+            kern1_inv = phi1k_local_2vN(ind, appr.Ek_grid_ext, appr.fkp, appr.hfkp, appr.hfkm,
+                                        appr.qd.Ea, appr.leads.Tba, appr.si)[1]
+            phi1k_delta_ref = phi1k_iterate_2vN(ind, appr.Ek_grid_ext, phi1k, hphi1k,
+                                                appr.fkp, kern1_inv, appr.qd.Ea, appr.leads.Tba, appr.si)
+            assert norm(phi1k_delta[j1] - phi1k_delta_ref) < EPS
+        # The interpolation tables are reused and the result does not depend on the chunks
+        phi1k_delta_chunks = phi1k_iterate_2vN_array(appr, phi1k, hphi1k, chunk_size=1)
+        assert appr.shift_tables is shift_tables
+        assert norm(phi1k_delta_chunks - phi1k_delta) < EPS
+
 
 def test_Builder_single_orbital_spinful():
     data_current = {'Pauli': [0.08368833245372147, -0.08368833245372037, 0.08368833245372147, -0.08368833245372037],
@@ -160,6 +160,13 @@ def test_Builder_elph_double_dot_spinful():
         for param in ['current', 'energy_current']:
             assert norm(getattr(system, param) - getattr(getattr(calcs, attr), param)) < EPS
 
+        # Check sparse solution of the kernel
+        system = SpinfulDoubleDotWithElPh(kerntype=kerntype, itype=itype, itype_ph=itype_ph)
+        system.solmethod = 'spsolve'
+        system.solve()
+        for param in ['current', 'energy_current']:
+            assert norm(getattr(system, param) - getattr(getattr(calcs, attr), param)) < EPS
+
     # Check results with different indexing
     kerns = ['Pauli', 'Redfield', '1vN', 'Lindblad']
     kerns += ['pyPauli', 'pyRedfield', 'py1vN', 'pyLindblad'] if CHECK_PY else []
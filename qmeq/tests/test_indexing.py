@@ -396,8 +396,12 @@ def test_StateIndexingDMc_charge():
     assert si.get_ind_dm0(8, 7, 2, maptype=2) == True
     assert si.get_ind_dm0(5, 8, 2, maptype=1) == 30
     assert si.get_ind_dm1(5, 4, 1) == 7
+    assert si.transpdm0[40] == si.get_ind_dm0(8, 7, 2) == 45
+    assert list(si.transpdm0[0:16]) == list(range(16))
+    assert list(si.transpdm0[si.transpdm0]) == list(range(70))
     #
     si.set_statesdm([[0], [], [5, 6, 7, 8, 9, 10], [11, 12, 13, 14], []])
+    assert list(si.transpdm0[si.transpdm0]) == list(range(53))
     assert si.ndm0_  == 53
     assert si.ndm0 == 53
     assert si.ndm0r == 95
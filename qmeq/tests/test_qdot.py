@@ -278,3 +278,28 @@ def test_QuantumDot(symmetry=None):
 
 def test_QuantumDot_spin():
     test_QuantumDot(symmetry='spin')
+
+
+def test_QuantumDot_set_gate():
+    p = ParametersDoubleDotSpinful()
+    vgate = 3.5
+    hsingle_shifted = dict(p.hsingle)
+    for j in range(4):
+        hsingle_shifted[(j,j)] -= vgate
+    for indexing in ['Lin', 'charge', 'sz', 'ssq']:
+        si = StateIndexing(4, indexing=indexing)
+        qd = QuantumDot(p.hsingle, p.coulomb, si)
+        qd.diagonalise()
+        vecslst = qd.vecslst
+        qd.set_gate(vgate)
+        assert qd.vecslst is vecslst
+        qd_shifted = QuantumDot(dict(hsingle_shifted), p.coulomb, StateIndexing(4, indexing=indexing))
+        qd_shifted.diagonalise()
+        assert norm(qd.Ea - qd_shifted.Ea) < 1e-12
+        # The gate voltage is kept when the Hamiltonian is diagonalised again
+        qd.diagonalise()
+        assert norm(qd.Ea - qd_shifted.Ea) < 1e-12
+        qd.set_gate(0.0)
+        qd_shifted.change(hsingle=p.hsingle)
+        qd_shifted.diagonalise()
+        assert norm(qd.Ea - qd_shifted.Ea) < 1e-12
@@ -0,0 +1,56 @@
+import numpy as np
+from numpy.linalg import norm
+from qmeq.solvers import *
+
+EPS = 1e-12
+
+
+def make_generator(n, seed=0):
+    # Random kernel of continuous time Markov chain with columns summing to zero
+    rng = np.random.RandomState(seed)
+    kern = rng.rand(n, n)
+    np.fill_diagonal(kern, 0)
+    kern -= np.diag(kern.sum(axis=0))
+    return kern
+
+
+def test_solve_lstsq_qr():
+    kern = make_generator(6)
+    kern_ext = np.vstack([kern, np.ones(6)])
+    bvec_ext = np.zeros(7)
+    bvec_ext[-1] = 1
+    phi0, cond = solve_lstsq_qr(kern_ext, bvec_ext)
+    phi0_svd, cond_svd = solve_lstsq(kern_ext, bvec_ext)
+    assert norm(phi0 - phi0_svd) < EPS
+    assert 1 <= cond < np.inf and 1 <= cond_svd < np.inf
+    # Rank deficient matrix falls back to singular value decomposition
+    kern_ext[:, 1] = kern_ext[:, 0]
+    phi0, cond = solve_lstsq_qr(kern_ext, bvec_ext)
+    assert norm(phi0 - solve_lstsq(kern_ext, bvec_ext)[0]) < EPS
+
+
+def test_solve_lstsq_batch():
+    kern_ext = np.array([np.vstack([make_generator(6, seed), np.ones(6)]) for seed in range(3)])
+    bvec_ext = np.zeros((3, 7))
+    bvec_ext[:, -1] = 1
+    # Rank deficient matrix is solved by singular value decomposition
+    kern_ext[1, :, 1] = kern_ext[1, :, 0]
+    phi0 = solve_lstsq_batch(kern_ext, bvec_ext)
+    for i in range(3):
+        assert norm(phi0[i] - solve_lstsq(kern_ext[i], bvec_ext[i])[0]) < EPS
+
+
+def test_solve_null_lu():
+    kern = make_generator(6)
+    norm_vec = np.ones(6)
+    phi0, cond = solve_null_lu(kern, norm_vec)
+    assert norm(np.dot(kern, phi0)) < EPS
+    assert abs(np.dot(norm_vec, phi0) - 1) < EPS
+    assert 1 <= cond < np.inf
+    # Kernel without a null vector falls back to least squares
+    kern[0, 0] -= 1.0
+    phi0, cond = solve_null_lu(kern, norm_vec)
+    kern_ext = np.vstack([kern, norm_vec])
+    bvec_ext = np.zeros(7)
+    bvec_ext[-1] = 1
+    assert norm(phi0 - solve_lstsq(kern_ext, bvec_ext)[0]) < EPS
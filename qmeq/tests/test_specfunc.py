@@ -1,7 +1,9 @@
 import numpy as np
+import itertools
 from numpy.linalg import norm
 from scipy import exp
 from scipy.integrate import quad
+from scipy.special import dawsn
 from qmeq.specfunc import *
 
 EPS = 1e-14
@@ -31,6 +33,16 @@ def test_func_pauli():
             assert norm( f(Ecb, mu, T, Dm, Dp, itype) - [0.04163676679420959, 6.241548540385377] ) < EPS
 
 
+def test_func_pauli_array():
+    Ecb = np.array([-20, -4.99, 0, 4.99, 5.01])
+    mu, T, Dm, Dp = np.array([0, 1]), np.array([1, 2]), np.array([-5, -5]), np.array([5, 5])
+    for itype in [0, 1, 2, 3]:
+        rez = func_pauli_array(Ecb, mu, T, Dm, Dp, itype)
+        assert rez.shape == (2, 5, 2)
+        for l, i in itertools.product(range(2), range(5)):
+            assert norm(rez[l, i] - func_pauli(Ecb[i], mu[l], T[l], Dm[l], Dp[l], itype)) < EPS
+
+
 def test_func_1vN():
 
     def test_rez(Ecb, mu, T, Dm, Dp):
@@ -61,3 +73,60 @@ def test_func_1vN():
             assert norm(r0.imag - np.zeros(4)) < EPS
             r0 = f(Dm-0.1, mu, T, Dm, Dp, itype, 10000)
             assert norm(r0.imag - np.zeros(4)) < EPS
+
+
+def test_PrincipalValueTable():
+    for Rm, Rp in [(-50., 45.), (-12., 800.), (-10., 15.), (-2., 30.), (3., 20.)]:
+        table = PrincipalValueTable(Rm, Rp)
+        assert table.wideq == (Rm < -10. and Rp > 10.)
+        assert table.wideq or table.spline is not None
+        alpha = np.array([Rm-1.0, Rm+0.01, -3.3, 0.0, 0.7, 12.0, Rp-0.01, Rp+2.0])
+        rez = table(alpha)
+        for a, val in zip(alpha, rez):
+            ref, err = quad(fermi_func, Rm, Rp, weight='cauchy', wvar=a, epsabs=1e-12, epsrel=1e-12, limit=10000)
+            assert abs(val - ref) < 1e-7
+        # The table for the reflected band edges gives the same integrals
+        assert norm(PrincipalValueTable(-Rp, -Rm).reflected(alpha) - rez) < 1e-7
+    # The tabulated integral replaces dqawc in func_1vN
+    Ecb, mu, T, Dm, Dp = 0.5, 0.3, 1.0, -10., 15.
+    pv = PrincipalValueTable((Dm-mu)/T, (Dp-mu)/T)([(Ecb-mu)/T])[0]
+    for f in [func_1vN, c_func_1vN]:
+        assert norm(f(Ecb, mu, T, Dm, Dp, 0, 10000, pv) - f(Ecb, mu, T, Dm, Dp, 0, 10000)) < 1e-7
+
+
+def test_func_1vN_array():
+    Ecb = np.array([-20, -4.99, 0, 0.5, 4.99, 5.01])
+    mu, T, Dm, Dp = np.array([0.3, -1]), np.array([1, 2]), np.array([-5, -10]), np.array([5, 15])
+    for itype in [0, 1, 2, 3]:
+        rez = func_1vN_array(Ecb, mu, T, Dm, Dp, itype, 10000)
+        assert rez.shape == (2, 6, 4)
+        for l, i in itertools.product(range(2), range(6)):
+            assert norm(rez[l, i] - func_1vN(Ecb[i], mu[l], T[l], Dm[l], Dp[l], itype, 10000)) < EPS2
+
+
+def test_HilbertTransform():
+    n = 64
+    x = np.linspace(-5, 5, n)
+    fk = np.array([1/(np.exp(x)+1), 1/(np.exp(x/2-1)+1)]).T
+    phi1k = (np.exp(-x**2)[:, None, None]*(np.arange(1, 7) + 1j*np.arange(6)[::-1]).reshape(1, 2, 3))
+    htransf = HilbertTransform()
+    hfk = htransf(fk)
+    assert hfk.dtype == np.float64 and hfk.shape == fk.shape
+    for l in range(2):
+        assert norm(hfk[:, l] - hilbert_fredriksen(fk[:, l]).real) < EPS2
+    hphi1k = np.zeros(phi1k.shape, dtype=complex)
+    assert htransf(phi1k, out=hphi1k) is hphi1k
+    for i, j in itertools.product(range(2), range(3)):
+        assert norm(hphi1k[:, i, j] - hilbert_fredriksen(phi1k[:, i, j])) < EPS2
+    assert list(htransf.kernels) == [(n, 2*n)]
+    # The cached buffers are reused
+    assert norm(htransf(phi1k) - hphi1k) < EPS
+    assert len(htransf.buffers) == 2
+    assert htransf.workers == 1
+    assert norm(htransf(phi1k, workers=2) - hphi1k) < EPS
+    # Non-equidistant grid
+    assert norm(kernel_hilbert_grid(x).dot(fk) - hfk) < EPS2
+    xs = np.sort(np.concatenate((np.linspace(-8, 8, 200), np.random.RandomState(0).uniform(-1, 1, 100))))
+    hf = htransf(np.exp(-xs**2), grid=xs)
+    assert np.max(np.abs(hf - 2/np.sqrt(np.pi)*dawsn(xs))) < 2e-3
+    assert htransf.grid is not None and htransf.matrix.shape == (300, 300)
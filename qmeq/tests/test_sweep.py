@@ -0,0 +1,210 @@
+import pickle
+import numpy as np
+from numpy.linalg import norm
+from concurrent.futures import ProcessPoolExecutor
+from qmeq.builder.builder import Builder
+from qmeq.builder.sweep import *
+import itertools
+
+EPS = 1e-12
+
+
+class ParametersDoubleDotSpinless(object):
+
+    def __init__(self):
+        tL, tR = 2.0, 1.0
+        self.tleads = {(0,0): tL, (1,1): tR}
+        #
+        e1, e2, omega = -10, -12, 20
+        self.hsingle = {(0,0):e1, (1,1):e2, (0,1):omega}
+        uinter = 30.
+        self.coulomb = {(0,1,1,0):uinter}
+        #
+        vbias, temp, dband = 5.0, 25.0, 1000.0
+        self.mulst = [vbias/2, -vbias/2]
+        self.tlst = [temp, temp]
+        self.dlst = [dband, dband]
+        #
+        self.nsingle, self.nleads = 2, 2
+
+
+def make_system(p, kerntype):
+    return Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                   kerntype=kerntype, itype=2)
+
+
+def test_make_points():
+    points = make_points({'mulst': [[1, -1], [2, -2]], 'hsingle': [{(0,0): 1}, {(0,0): 2}, {(0,0): 3}]})
+    assert len(points) == 6
+    assert points[1] == {'mulst': [1, -1], 'hsingle': {(0,0): 2}}
+    points = make_points([{'mulst': [1, -1]}, {'tlst': [1, 1]}])
+    assert points == [{'mulst': [1, -1]}, {'tlst': [1, 1]}]
+
+
+def test_get_stage():
+    assert get_stage({'mulst': [1, -1]}, None) == 'qd'
+    assert get_stage({'mulst': [1, -1]}, {'mulst': [1, -1]}) is None
+    assert get_stage({'mulst': [1, -1]}, {'mulst': [2, -2]}) == 'master'
+    assert get_stage({'mulst': [1, -1], 'tleads': {(0,0): 1}}, {'mulst': [2, -2], 'tleads': {(0,0): 2}}) == 'leads'
+    assert get_stage({'mulst': [1, -1], 'hsingle': {(0,0): 1}}, {'mulst': [1, -1], 'hsingle': {(0,0): 2}}) == 'qd'
+    assert get_stage({'itype': 1}, {'itype': 2}) == 'master'
+
+
+def test_sweep():
+    p = ParametersDoubleDotSpinless()
+    vlst = np.linspace(-20, 20, 5)
+    e1lst = [-10, -5]
+    param_grid = {'hsingle': [{(0,0): e1} for e1 in e1lst],
+                  'tleads': [{(0,0): 2.0}, {(0,0): 1.5}],
+                  'mulst': [[v/2, -v/2] for v in vlst]}
+    for kerntype in ['Pauli', '1vN', 'pyPauli']:
+        system = make_system(p, kerntype)
+        results = system.sweep(param_grid)
+        #
+        assert results.current.shape == (20, p.nleads)
+        assert results.phi0.shape[0] == 20
+        assert results.stages[0:6] == ['qd', 'master', 'master', 'master', 'master', 'leads']
+        assert results.stages[10] == 'qd'
+        assert all(results.success)
+        # Compare with separate calculations
+        for i, point in enumerate(results.points):
+            system = make_system(p, kerntype)
+            system.change(**point)
+            system.solve()
+            for param in ['current', 'energy_current', 'heat_current', 'phi0']:
+                assert norm(getattr(results, param)[i] - getattr(system, param)) < EPS
+
+
+def test_sweep_no_diagonalisation():
+    p = ParametersDoubleDotSpinless()
+    system = make_system(p, 'Pauli')
+    ndiag = [0]
+    diagonalise = system.qd.diagonalise
+
+    def counted_diagonalise():
+        ndiag[0] += 1
+        diagonalise()
+    system.qd.diagonalise = counted_diagonalise
+    results = system.sweep([{'mulst': [v/2, -v/2]} for v in np.linspace(-20, 20, 11)])
+    assert ndiag[0] == 1
+    assert results.current.shape == (11, p.nleads)
+
+
+def test_pickle_builder():
+    p = ParametersDoubleDotSpinless()
+    for kerntype in ['Pauli', 'pyPauli', '1vN', '2vN']:
+        system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                         kerntype=kerntype, itype=2, kpnt=64)
+        system.solve(niter=2)
+        system_copy = pickle.loads(pickle.dumps(system))
+        assert type(system_copy.appr) is type(system.appr)
+        assert norm(system_copy.current - system.current) < EPS
+        system_copy.solve(niter=2)
+        assert norm(system_copy.current - system.current) < EPS
+
+
+def test_parallel_sweep():
+    p = ParametersDoubleDotSpinless()
+    param_grid = {'hsingle': [{(0,0): -10}, {(0,0): -5}],
+                  'mulst': [[v/2, -v/2] for v in np.linspace(-20, 20, 5)]}
+    system = make_system(p, 'Pauli')
+    results = system.sweep(param_grid)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        results_par = parallel_sweep(system, param_grid, executor=executor, chunksize=3)
+    assert results_par.current.shape == results.current.shape
+    for param in ['current', 'energy_current', 'heat_current', 'phi0']:
+        assert norm(getattr(results_par, param) - getattr(results, param)) < EPS
+    assert results_par.stages[0:4] == ['qd', 'master', 'master', 'qd']
+    # The builder is sent once to each worker of the created process pool
+    results_par = parallel_sweep(system, param_grid, chunksize=3, max_workers=2)
+    for param in ['current', 'energy_current', 'heat_current', 'phi0']:
+        assert norm(getattr(results_par, param) - getattr(results, param)) < EPS
+
+
+def test_sweep_warm_start():
+    p = ParametersDoubleDotSpinless()
+    param_grid = {'hsingle': [{(0,0): -10}, {(0,0): -9.5}],
+                  'mulst': [[v/2, -v/2] for v in np.linspace(-20, 20, 9)]}
+    for kerntype in ['Pauli', '1vN']:
+        results = make_system(p, kerntype).sweep(param_grid)
+        for solmethod, mfreeq in [('gmres', False), ('bicgstab', False), (None, True)]:
+            system = make_system(p, kerntype)
+            system.solmethod, system.mfreeq, system.warmq = solmethod, mfreeq, True
+            results_warm = system.sweep(param_grid)
+            assert all(results_warm.success)
+            assert norm(results_warm.current - results.current) < (1e-5 if mfreeq else 1e-8)
+            if not mfreeq:
+                assert system.appr.ilu is not None
+    # The Builder with stored preconditioner can be pickled
+    system_copy = pickle.loads(pickle.dumps(system))
+    assert system_copy.appr.ilu is None
+
+
+def test_batch_sweep():
+    p = ParametersDoubleDotSpinless()
+    param_grid = {'tlst': [[5.0, 5.0], {0: 20.0}],
+                  'mulst': [[v/2, -v/2] for v in np.linspace(-20, 20, 9)]}
+    for kerntype, symq in itertools.product(['Pauli', 'pyPauli', '1vN'], [True, False]):
+        system = make_system(p, kerntype)
+        system.symq = symq
+        results = system.sweep(param_grid)
+        system = make_system(p, kerntype)
+        system.symq = symq
+        results_batch = system.batch_sweep(param_grid, batch_size=4)
+        assert all(results_batch.success)
+        assert results_batch.current.shape == (18, p.nleads)
+        for param in ['current', 'energy_current', 'heat_current', 'phi0']:
+            assert norm(getattr(results_batch, param) - getattr(results, param)) < 1e-10
+        assert norm(system.current - results.current[-1]) < 1e-10
+        assert system.tlst.tolist() == [20.0, 5.0]
+
+
+def test_stability_diagram():
+    p = ParametersDoubleDotSpinless()
+    vgatelst, vbiaslst = [0.0, 4.0, 8.0], np.linspace(-20, 20, 5)
+    for kerntype in ['Pauli', 'pyPauli', '1vN']:
+        system = make_system(p, kerntype)
+        ndiag = [0]
+        diagonalise = system.qd.diagonalise
+
+        def counted_diagonalise():
+            ndiag[0] += 1
+            diagonalise()
+        system.qd.diagonalise = counted_diagonalise
+        results = system.stability_diagram(vgatelst, vbiaslst, batch_size=3)
+        assert ndiag[0] == 1
+        assert results.current.shape == (3, 5, p.nleads)
+        assert results.success.shape == (3, 5)
+        assert system.vgate == 8.0
+        # Compare with the gate voltage included in the single-particle energies
+        for i, vgate in enumerate(vgatelst):
+            for j, vbias in enumerate(vbiaslst):
+                p_ref = ParametersDoubleDotSpinless()
+                hsingle = dict(p_ref.hsingle)
+                hsingle[(0,0)] -= vgate
+                hsingle[(1,1)] -= vgate
+                system_ref = make_system(p_ref, kerntype)
+                system_ref.change(hsingle=hsingle, mulst=[vbias/2, -vbias/2])
+                system_ref.solve()
+                assert norm(results.current[i, j] - system_ref.current) < 1e-10
+                assert norm(results.phi0[i, j] - system_ref.phi0) < 1e-10
+
+
+def test_sweep_2vN_warm_start():
+    p = ParametersDoubleDotSpinless()
+    param_grid = [{'mulst': [v/2, -v/2]} for v in np.linspace(-20, 20, 11)]
+    for kerntype, grid_2vN in [('2vN', 'uniform'), ('py2vN', 'adaptive')]:
+        niter, results = [], []
+        for warmq in [False, True]:
+            system = Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst,
+                             kerntype=kerntype, itype=2, kpnt=128)
+            system.funcp.grid_2vN, system.warmq = grid_2vN, warmq
+            count = [0]
+
+            def func_iter(appr):
+                count[0] += 1
+            results.append(system.sweep(param_grid, tol=1e-7, maxiter=300, func_iter=func_iter))
+            niter.append(count[0])
+            assert system.appr.converged
+        assert niter[1] < niter[0]
+        assert norm(results[1].current - results[0].current) < 1e-5
@@ -91,6 +91,7 @@ def test_get_phi0_and_get_phi1():
     p = ParametersDoubleDotSpinless()
     system = qmeq.Builder(p.nsingle, p.hsingle, p.coulomb, p.nleads, p.tleads, p.mulst, p.tlst, p.dlst2,
                           kerntype='1vN', itype=0)
+    system.pv_tableq = False
     system.solve()
     assert norm(abs(system.get_phi0(1, 2)) - 0.00284121629354) < EPS
     assert norm(system.get_phi0(1, 2).conjugate() - system.get_phi0(2, 1)) < EPS
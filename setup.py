@@ -22,7 +22,8 @@ def get_ext_modules():
     """
 
     # Check if *.c files are already there
-    file_list = ['qmeq/approach/base/c_pauli.c',
+    file_list = ['qmeq/approach/base/c_kernel_handler.c',
+                 'qmeq/approach/base/c_pauli.c',
                  'qmeq/approach/base/c_lindblad.c',
                  'qmeq/approach/base/c_redfield.c',
                  'qmeq/approach/base/c_neumann1.c',
@@ -52,12 +53,26 @@ def get_ext_modules():
         file_ext = '.pyx'
         # print('using cythonize to generate C files')
 
+    # Modules with OpenMP parallel loops. On macOS the default compiler does not support
+    # OpenMP, so the loops are compiled serially there.
+    openmp_list = ['qmeq/approach/base/c_neumann2.c']
+    if sys.platform.startswith('win'):
+        openmp_args = (['/openmp'], [])
+    elif sys.platform == 'darwin':
+        openmp_args = ([], [])
+    else:
+        openmp_args = (['-fopenmp'], ['-fopenmp'])
+
     ext = []
     for file_no_ext in file_list:
         file_base = file_no_ext[:-2]
         file_name = file_base + file_ext
         module_name = file_base.replace('/', '.')
-        ext.append(Extension(module_name, [file_name]))
+        if file_no_ext in openmp_list:
+            ext.append(Extension(module_name, [file_name],
+                                 extra_compile_args=openmp_args[0], extra_link_args=openmp_args[1]))
+        else:
+            ext.append(Extension(module_name, [file_name]))
 
     cext = ext if cythonize is None else cythonize(ext)
     return cext